@@ -5,8 +5,7 @@ import csv
 import subprocess
 import os
 import threading
-from queue import Queue, Empty as QueueEmpty
-import queue as _queue
+from utils.lazy_imports import lazy, module_available
 
 # Kiểm tra và cài đặt dependencies tự động (chỉ khi chạy trực tiếp)
 def check_and_install_dependencies():
@@ -31,15 +30,11 @@ def check_and_install_dependencies():
         'numpy': 'numpy'
     }
     
-    missing_packages = []
-    for module_name, package_name in required_packages.items():
-        try:
-            if module_name == 'PIL':
-                __import__('PIL')
-            else:
-                __import__(module_name)
-        except ImportError:
-            missing_packages.append(package_name)
+    # find_spec: chỉ kiểm tra đã cài hay chưa, không import (tránh nạp selenium/reportlab... lúc khởi động)
+    missing_packages = [
+        package_name for module_name, package_name in required_packages.items()
+        if not module_available(module_name)
+    ]
     
     if missing_packages:
         print("=" * 70)
@@ -98,181 +93,36 @@ def check_and_install_dependencies():
 # GOOGLE SHEET BACKGROUND UPDATE                                             #
 # ============================================================================
 
-# Rate-limited queue cho Google Sheets updates
-_google_sheets_update_queue = Queue()
-_google_sheets_queue_worker_started = False
-_google_sheets_queue_lock = threading.Lock()
-
-# ===== BATCH QUEUE CONSTANTS =====
-BATCH_SIZE = 50  # Số records tối đa trong 1 batch
-BATCH_TIMEOUT = 2.0  # Seconds - flush batch nếu không đủ size sau khoảng thời gian này
-MIN_DELAY_BETWEEN_BATCHES = 1.0  # Seconds - delay giữa các batch để tránh rate limit
-
-def _google_sheets_queue_worker():
-    """
-    Worker thread xử lý queue Google Sheets updates với BATCH COLLECTOR
-    Gom nhiều requests thành batch để giảm số API calls
-    """
-    import time
-    from datetime import datetime
-
-    # Delay khi gặp 429 error
-    RETRY_DELAY_ON_429 = 5.0  # giây
-
-    def _log(msg):
-        try:
-            print(msg, flush=True, file=sys.stderr)
-        except Exception:
-            pass
-
-    _log("🔄 [SHEET_QUEUE_WORKER] Worker thread đã khởi động (BATCH MODE)")
-
-    batch = []  # Batch collector
-    last_batch_time = time.time()
-
-    while True:
-        try:
-            # Non-blocking get với timeout ngắn để có thể check batch timeout
-            try:
-                task = _google_sheets_update_queue.get(timeout=0.5)
-
-                if task is None:  # Sentinel để dừng worker
-                    # Flush remaining batch trước khi dừng
-                    if batch:
-                        _log(f"🛑 [SHEET_QUEUE_WORKER] Flush {len(batch)} records còn lại trước khi dừng...")
-                        _process_queue_batch(batch, _log)
-                    _log("🛑 [SHEET_QUEUE_WORKER] Nhận tín hiệu dừng, worker sẽ kết thúc")
-                    break
-
-                batch.append(task)
-                _google_sheets_update_queue.task_done()
-
-            except _queue.Empty:
-                pass  # Queue rỗng, tiếp tục check batch
-
-            # Kiểm tra điều kiện flush batch
-            should_flush = (
-                len(batch) >= BATCH_SIZE or
-                (batch and time.time() - last_batch_time >= BATCH_TIMEOUT)
-            )
-
-            if should_flush and batch:
-                _log(f"🚀 [SHEET_QUEUE_WORKER] Flush batch: {len(batch)} records")
-
-                # Process batch
-                success = _process_queue_batch(batch, _log)
-
-                # Reset batch
-                batch = []
-                last_batch_time = time.time()
-
-                # Delay giữa các batches
-                time.sleep(MIN_DELAY_BETWEEN_BATCHES)
-
-        except Exception as e:
-            _log(f"❌ [SHEET_QUEUE_WORKER] Lỗi trong worker thread: {e}")
-            import traceback
-            _log(traceback.format_exc())
-            time.sleep(1)  # Đợi một chút trước khi tiếp tục
-
-
-def _process_queue_batch(batch, _log):
-    """
-    Xử lý một batch các tasks sử dụng batch update
-    """
-    import time
-
-    if not batch:
-        return True
-
-    try:
-        # Chuẩn bị dữ liệu cho batch update
-        # Mỗi task có format: (attendance_id, employee_team, employee_id, attendance_data)
-
-        # Tạo mock attendance objects cho batch update function
-        class MockAttendance:
-            def __init__(self, att_id):
-                self.id = att_id
-
-        batch_data = []
-        for task in batch:
-            attendance_id, employee_team, employee_id, attendance_data = task
-            mock_att = MockAttendance(attendance_id)
-            batch_data.append((mock_att, employee_team, employee_id, attendance_data))
-
-        # Gọi batch update
-        result = batch_update_multi_attendances_sync(batch_data)
-
-        _log(f"   ✅ Batch result: {len(result['success_ids'])} success, {len(result['failed'])} failed")
-        _log(f"   📡 API calls: {result['total_api_calls']}")
-
-        return len(result['failed']) == 0
-
-    except Exception as e:
-        _log(f"   ❌ Batch processing error: {e}")
-
-        # Fallback: xử lý từng record riêng lẻ
-        _log(f"   🔄 Fallback: xử lý {len(batch)} records riêng lẻ...")
-        for task in batch:
-            try:
-                attendance_id, employee_team, employee_id, attendance_data = task
-                update_google_sheet_background_safe_direct(
-                    attendance_id, employee_team, employee_id, attendance_data
-                )
-                time.sleep(1.2)  # Rate limiting
-            except Exception as inner_e:
-                _log(f"   ❌ Failed for ID {attendance_id}: {inner_e}")
-
-        return False
+# Việc cập nhật sheet nằm trong outbox SQLite (bảng sheet_sync_outbox) - xem utils/sheet_sync_outbox.py:
+# không mất khi restart, gộp theo ô, token bucket mỗi spreadsheet + backoff khi lỗi / 429.
+# Worker gom việc theo spreadsheet rồi gọi batch_update_multi_attendances_sync.
 
 def _ensure_google_sheets_queue_worker():
-    """Đảm bảo worker thread đã được khởi động"""
-    global _google_sheets_queue_worker_started
-    
-    with _google_sheets_queue_lock:
-        if not _google_sheets_queue_worker_started:
-            worker_thread = threading.Thread(
-                target=_google_sheets_queue_worker,
-                daemon=True,
-                name="GoogleSheetsQueueWorker"
-            )
-            worker_thread.start()
-            _google_sheets_queue_worker_started = True
-            print("🚀 [SHEET_QUEUE] Đã khởi động worker thread cho Google Sheets update queue", flush=True, file=sys.stderr)
+    """Đảm bảo worker outbox đã được khởi động (làm tiếp việc còn dở sau restart)"""
+    sheet_sync_outbox.start()
 
 def update_google_sheet_background_safe(attendance_id, employee_team, employee_id, attendance_data):
     """
-    Background task an toàn để cập nhật Google Sheet với rate limiting
-    Sử dụng queue để xử lý tuần tự, tránh vượt quota API
+    Ghi việc cập nhật Google Sheet vào outbox (commit ngay), worker xử lý theo lô có rate limit.
+    Cùng attendance_id còn đang chờ -> chỉ giữ giá trị mới nhất
     """
-    # Đảm bảo worker thread đã được khởi động
-    _ensure_google_sheets_queue_worker()
-    
-    # Thêm task vào queue
     try:
-        _google_sheets_update_queue.put((attendance_id, employee_team, employee_id, attendance_data), timeout=5)
-        print(f"📥 [SHEET_QUEUE] Đã thêm attendance ID {attendance_id} vào queue (queue size: {_google_sheets_update_queue.qsize()})", flush=True, file=sys.stderr)
+        task_id = sheet_sync_outbox.enqueue(attendance_id, employee_team, employee_id, attendance_data)
+        sheets_log.debug("📥 [SHEET_QUEUE] Đã thêm attendance ID %s vào outbox (#%s)", attendance_id, task_id)
     except Exception as e:
-        print(f"❌ [SHEET_QUEUE] Lỗi khi thêm vào queue: {e}", flush=True, file=sys.stderr)
+        sheets_log.error("❌ [SHEET_QUEUE] Lỗi khi thêm vào outbox: %s", e)
 
 def update_google_sheet_background_safe_direct(attendance_id, employee_team, employee_id, attendance_data):
     """
-    Hàm thực tế cập nhật Google Sheet (được gọi bởi queue worker)
+    Cập nhật Google Sheet trực tiếp cho 1 bản ghi (không qua outbox)
     Không làm crash app nếu có lỗi
     """
     import sys
     from datetime import datetime
     
-    # Log helper - chỉ log vào stderr để tránh I/O operation on closed file
-    def _log(msg):
-        try:
-            print(msg, flush=True, file=sys.stderr)
-        except Exception:
-            pass
-    
     try:
-        _log(f"🔵 [SHEET_UPDATE] HÀM ĐƯỢC GỌI - ID: {attendance_id}")
-        _log(f"   Team: {employee_team}, Employee ID: {employee_id}")
+        sheets_log.debug("🔵 [SHEET_UPDATE] HÀM ĐƯỢC GỌI - ID: %s", attendance_id)
+        sheets_log.debug("   Team: %s, Employee ID: %s", employee_team, employee_id)
         
         # Lazy access to app - app được định nghĩa sau trong file này
         # Sử dụng globals() để lấy app instance khi function được gọi
@@ -281,40 +131,40 @@ def update_google_sheet_background_safe_direct(attendance_id, employee_team, emp
         flask_app = getattr(current_module, 'app', None)
         
         if flask_app is None:
-            _log(f"❌ [SHEET_UPDATE] Flask app chưa được khởi tạo")
+            sheets_log.error("❌ [SHEET_UPDATE] Flask app chưa được khởi tạo")
             return
         
-        _log(f"🔵 [SHEET_UPDATE] Tạo app context...")
+        sheets_log.debug("🔵 [SHEET_UPDATE] Tạo app context...")
         with flask_app.app_context():
-            _log(f"🔵 [SHEET_UPDATE] Đã vào app context")
+            sheets_log.debug("🔵 [SHEET_UPDATE] Đã vào app context")
             
             # Khởi tạo Google API
-            _log(f"🔵 [SHEET_UPDATE] Khởi tạo GoogleDriveAPI...")
+            sheets_log.debug("🔵 [SHEET_UPDATE] Khởi tạo GoogleDriveAPI...")
             try:
                 google_api = GoogleDriveAPI()
-                _log(f"🔵 [SHEET_UPDATE] Đã khởi tạo GoogleDriveAPI")
+                sheets_log.debug("🔵 [SHEET_UPDATE] Đã khởi tạo GoogleDriveAPI")
             except Exception as api_init_err:
-                _log(f"❌ [SHEET_UPDATE] Lỗi khởi tạo GoogleDriveAPI: {api_init_err}")
+                sheets_log.error("❌ [SHEET_UPDATE] Lỗi khởi tạo GoogleDriveAPI: %s", api_init_err)
                 import traceback
-                _log(f"   Traceback: {traceback.format_exc()}")
+                sheets_log.error("   Traceback: %s", traceback.format_exc())
                 return
             
             # Kiểm tra token
-            _log(f"🔵 [SHEET_UPDATE] Kiểm tra token...")
+            sheets_log.debug("🔵 [SHEET_UPDATE] Kiểm tra token...")
             try:
                 token_valid = google_api.ensure_valid_token()
                 if not token_valid:
-                    _log(f"❌ [SHEET_UPDATE] Token không hợp lệ")
+                    sheets_log.error("❌ [SHEET_UPDATE] Token không hợp lệ")
                     return
-                _log(f"✅ [SHEET_UPDATE] Token hợp lệ")
+                sheets_log.info("✅ [SHEET_UPDATE] Token hợp lệ")
             except Exception as token_err:
-                _log(f"❌ [SHEET_UPDATE] Lỗi kiểm tra token: {token_err}")
+                sheets_log.error("❌ [SHEET_UPDATE] Lỗi kiểm tra token: %s", token_err)
                 import traceback
-                _log(f"   Traceback: {traceback.format_exc()}")
+                sheets_log.error("   Traceback: %s", traceback.format_exc())
                 return
             
             if not google_api.sheets_service:
-                _log(f"❌ [SHEET_UPDATE] Google Sheets service không khả dụng")
+                sheets_log.error("❌ [SHEET_UPDATE] Google Sheets service không khả dụng")
                 return
             
             # Tìm tháng của ngày nghỉ
@@ -324,22 +174,22 @@ def update_google_sheet_background_safe_direct(attendance_id, employee_team, emp
                 try:
                     attendance_dt = datetime.strptime(attendance_date_str, "%Y-%m-%d")
                     attendance_month = attendance_dt.strftime("%Y%m")
-                    _log(f"📅 [SHEET_UPDATE] Ngày: {attendance_date_str} -> Tháng: {attendance_month}")
+                    sheets_log.debug("📅 [SHEET_UPDATE] Ngày: %s -> Tháng: %s", attendance_date_str, attendance_month)
                 except ValueError as date_err:
-                    _log(f"⚠️ [SHEET_UPDATE] Lỗi parse ngày: {date_err}")
+                    sheets_log.warning("⚠️ [SHEET_UPDATE] Lỗi parse ngày: %s", date_err)
             
             current_month = attendance_month or datetime.now().strftime("%Y%m")
-            _log(f"🔍 [SHEET_UPDATE] Tìm file - Team: {employee_team}, Month: {current_month}, Employee ID: {employee_id}")
+            sheets_log.debug("🔍 [SHEET_UPDATE] Tìm file - Team: %s, Month: %s, Employee ID: %s", employee_team, current_month, employee_id)
             
             # Validation: Kiểm tra employee_id và team trước khi tìm file
             if not employee_id:
-                _log(f"❌ [SHEET_UPDATE] VALIDATION ERROR: Không có employee_id")
-                _log(f"   ⚠️ Vui lòng cập nhật employee_id cho user trong database")
+                sheets_log.error("❌ [SHEET_UPDATE] VALIDATION ERROR: Không có employee_id")
+                sheets_log.warning("   ⚠️ Vui lòng cập nhật employee_id cho user trong database")
                 return
             
             if not employee_team or employee_team == "Unknown":
-                _log(f"❌ [SHEET_UPDATE] VALIDATION ERROR: Team/Department không hợp lệ: {employee_team}")
-                _log(f"   ⚠️ Vui lòng cập nhật department cho user trong database")
+                sheets_log.error("❌ [SHEET_UPDATE] VALIDATION ERROR: Team/Department không hợp lệ: %s", employee_team)
+                sheets_log.warning("   ⚠️ Vui lòng cập nhật department cho user trong database")
                 return
             
             # Tìm file
@@ -350,29 +200,29 @@ def update_google_sheet_background_safe_direct(attendance_id, employee_team, emp
                     month_year=current_month
                 )
             except Exception as find_err:
-                _log(f"❌ [SHEET_UPDATE] Lỗi khi tìm file: {find_err}")
+                sheets_log.error("❌ [SHEET_UPDATE] Lỗi khi tìm file: %s", find_err)
                 import traceback
-                _log(f"   Traceback: {traceback.format_exc()}")
+                sheets_log.error("   Traceback: %s", traceback.format_exc())
                 return
             
             if not target_file:
-                _log(f"❌ [SHEET_UPDATE] KHÔNG TÌM THẤY FILE - Team: {employee_team}, Month: {current_month}")
-                _log(f"   ⚠️ Vui lòng kiểm tra:")
-                _log(f"      1. File Google Sheet cho team '{employee_team}' tháng {current_month} có tồn tại không?")
-                _log(f"      2. Tên file có đúng format không? (ví dụ: Bud_TimeSheet-{current_month})")
-                _log(f"      3. File có trong folder Google Drive đúng không?")
-                _log(f"      4. Mapping department -> file name trong database có đúng không?")
+                sheets_log.error("❌ [SHEET_UPDATE] KHÔNG TÌM THẤY FILE - Team: %s, Month: %s", employee_team, current_month)
+                sheets_log.warning("   ⚠️ Vui lòng kiểm tra:")
+                sheets_log.warning("      1. File Google Sheet cho team '%s' tháng %s có tồn tại không?", employee_team, current_month)
+                sheets_log.warning("      2. Tên file có đúng format không? (ví dụ: Bud_TimeSheet-%s)", current_month)
+                sheets_log.warning("      3. File có trong folder Google Drive đúng không?")
+                sheets_log.warning("      4. Mapping department -> file name trong database có đúng không?")
                 return
             
-            _log(f"✅ [SHEET_UPDATE] Tìm thấy file: {target_file.get('name', 'N/A')} (ID: {target_file.get('id', 'N/A')})")
+            sheets_log.info("✅ [SHEET_UPDATE] Tìm thấy file: %s (ID: %s)", target_file.get('name', 'N/A'), target_file.get('id', 'N/A'))
             
             # Cập nhật sheet
-            _log(f"🚀 [SHEET_UPDATE] Gọi update_timesheet_for_attendance...")
-            _log(f"   Spreadsheet ID: {target_file['id']}")
-            _log(f"   Sheet Name: {employee_id}")
-            _log(f"   Data Keys: {list(attendance_data.keys())}")
+            sheets_log.debug("🚀 [SHEET_UPDATE] Gọi update_timesheet_for_attendance...")
+            sheets_log.debug("   Spreadsheet ID: %s", target_file['id'])
+            sheets_log.debug("   Sheet Name: %s", employee_id)
+            sheets_log.debug("   Data Keys: %s", list(attendance_data.keys()))
             if 'leave_summary' in attendance_data:
-                _log(f"   Leave Summary: {attendance_data['leave_summary']}")
+                sheets_log.debug("   Leave Summary: %s", attendance_data['leave_summary'])
             
             try:
                 success = google_api.update_timesheet_for_attendance(
@@ -380,38 +230,38 @@ def update_google_sheet_background_safe_direct(attendance_id, employee_team, emp
                     sheet_name=str(employee_id),
                     attendance_data=attendance_data
                 )
-                _log(f"📊 [SHEET_UPDATE] Kết quả: {success}")
+                sheets_log.debug("📊 [SHEET_UPDATE] Kết quả: %s", success)
             
                 if success:
-                    _log(f"✅ [SHEET_UPDATE] Cập nhật thành công - File: {target_file['name']}, Sheet: {employee_id}")
+                    sheets_log.info("✅ [SHEET_UPDATE] Cập nhật thành công - File: %s, Sheet: %s", target_file['name'], employee_id)
                     try:
-                        create_backup()
-                        _log(f"🛡️ [SHEET_UPDATE] Đã tạo backup")
+                        request_backup()
+                        sheets_log.debug("🛡️ [SHEET_UPDATE] Đã yêu cầu backup")
                     except Exception as backup_error:
-                        _log(f"⚠️ [SHEET_UPDATE] Lỗi tạo backup: {backup_error}")
+                        sheets_log.warning("⚠️ [SHEET_UPDATE] Lỗi yêu cầu backup: %s", backup_error)
                 else:
-                    _log(f"❌ [SHEET_UPDATE] Cập nhật thất bại")
+                    sheets_log.error("❌ [SHEET_UPDATE] Cập nhật thất bại")
             except Exception as update_err:
                 error_str = str(update_err)
-                _log(f"❌ [SHEET_UPDATE] Lỗi khi gọi update_timesheet_for_attendance: {update_err}")
+                sheets_log.error("❌ [SHEET_UPDATE] Lỗi khi gọi update_timesheet_for_attendance: %s", update_err)
                 import traceback
-                _log(f"   Traceback: {traceback.format_exc()}")
+                sheets_log.error("   Traceback: %s", traceback.format_exc())
                 
                 # Nếu là rate limit error (429), raise lại để queue worker có thể retry
                 if '429' in error_str or 'RATE_LIMIT_EXCEEDED' in error_str or 'Quota exceeded' in error_str:
-                    _log(f"⚠️ [SHEET_UPDATE] Phát hiện rate limit error (429), sẽ retry...")
+                    sheets_log.warning("⚠️ [SHEET_UPDATE] Phát hiện rate limit error (429), sẽ retry...")
                     raise  # Re-raise để queue worker xử lý retry
             
     except Exception as e:
         import traceback
         try:
-            _log(f"❌ [SHEET_UPDATE] LỖI TỔNG QUÁT: {str(e)}")
-            _log(f"   Type: {type(e).__name__}")
-            _log(f"   Traceback:\n{traceback.format_exc()}")
+            sheets_log.error("❌ [SHEET_UPDATE] LỖI TỔNG QUÁT: %s", str(e))
+            sheets_log.error("   Type: %s", type(e).__name__)
+            sheets_log.error("   Traceback:\n%s", traceback.format_exc())
         except Exception:
             # Nếu ngay cả logging cũng lỗi, thử print trực tiếp
             try:
-                print(f"❌ [SHEET_UPDATE] CRITICAL ERROR: {str(e)}", flush=True, file=sys.stderr)
+                sheets_log.error("❌ [SHEET_UPDATE] CRITICAL ERROR: %s", str(e))
             except Exception:
                 pass
 
@@ -429,13 +279,6 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
     from datetime import datetime as dt
     import signal
     
-    def _log(msg):
-        """Helper function for logging"""
-        try:
-            print(msg, flush=True, file=sys.stderr)
-        except Exception:
-            pass
-    
     # Handler cho timeout
     class TimeoutException(Exception):
         pass
@@ -443,44 +286,41 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
     def timeout_handler(signum, frame):
         raise TimeoutException("Google Sheet update timeout")
     
-    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    _log(f"\n{'='*80}")
-    _log(f"🔵 [SYNC_SHEET_UPDATE] {timestamp} - Bắt đầu cập nhật ĐỒNG BỘ")
-    _log(f"   Attendance ID: {attendance_id}")
-    _log(f"   Employee: {attendance_data.get('user_name', 'Unknown')}")
-    _log(f"   Team: {employee_team}")
-    _log(f"   Employee ID: {employee_id}")
-    _log(f"   Date: {attendance_data.get('date', 'Unknown')}")
-    _log(f"{'='*80}")
+    sheets_log.debug("🔵 [SYNC_SHEET_UPDATE] Bắt đầu cập nhật ĐỒNG BỘ")
+    sheets_log.debug("   Attendance ID: %s", attendance_id)
+    sheets_log.debug("   Employee: %s", attendance_data.get('user_name', 'Unknown'))
+    sheets_log.debug("   Team: %s", employee_team)
+    sheets_log.debug("   Employee ID: %s", employee_id)
+    sheets_log.debug("   Date: %s", attendance_data.get('date', 'Unknown'))
     
     try:
         # VALIDATION 1: Kiểm tra employee_id
         if not employee_id:
             error_msg = f"❌ Không có employee_id cho user"
-            _log(f"[VALIDATION_ERROR] {error_msg}")
-            _log(f"   ⚠️ Vui lòng cập nhật employee_id trong database trước khi phê duyệt")
+            sheets_log.error("[VALIDATION_ERROR] %s", error_msg)
+            sheets_log.warning("   ⚠️ Vui lòng cập nhật employee_id trong database trước khi phê duyệt")
             return (False, error_msg)
         
         # VALIDATION 2: Kiểm tra team/department
         if not employee_team or employee_team == "Unknown":
             error_msg = f"❌ Department không hợp lệ: '{employee_team}'"
-            _log(f"[VALIDATION_ERROR] {error_msg}")
-            _log(f"   ⚠️ Vui lòng cập nhật department trong database trước khi phê duyệt")
+            sheets_log.error("[VALIDATION_ERROR] %s", error_msg)
+            sheets_log.warning("   ⚠️ Vui lòng cập nhật department trong database trước khi phê duyệt")
             return (False, error_msg)
         
         # VALIDATION 3: Kiểm tra attendance_data
         if not attendance_data or not isinstance(attendance_data, dict):
             error_msg = "❌ Dữ liệu attendance không hợp lệ"
-            _log(f"[VALIDATION_ERROR] {error_msg}")
+            sheets_log.error("[VALIDATION_ERROR] %s", error_msg)
             return (False, error_msg)
         
         date_str = attendance_data.get('date')
         if not date_str:
             error_msg = "❌ Thiếu thông tin ngày trong attendance_data"
-            _log(f"[VALIDATION_ERROR] {error_msg}")
+            sheets_log.error("[VALIDATION_ERROR] %s", error_msg)
             return (False, error_msg)
         
-        _log(f"✅ [VALIDATION_PASS] Tất cả validations đã pass")
+        sheets_log.info("✅ [VALIDATION_PASS] Tất cả validations đã pass")
         
         # Lấy app context - cần thiết vì hàm này có thể được gọi từ request context
         import sys
@@ -489,43 +329,43 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
         
         if flask_app is None:
             error_msg = "❌ Flask app chưa được khởi tạo"
-            _log(f"[APP_ERROR] {error_msg}")
+            sheets_log.error("[APP_ERROR] %s", error_msg)
             return (False, error_msg)
         
-        _log(f"🔵 [APP_CONTEXT] Sử dụng Flask app context")
+        sheets_log.debug("🔵 [APP_CONTEXT] Sử dụng Flask app context")
         
         # Khởi tạo Google API
-        _log(f"🔵 [GOOGLE_API] Khởi tạo GoogleDriveAPI...")
+        sheets_log.debug("🔵 [GOOGLE_API] Khởi tạo GoogleDriveAPI...")
         try:
             google_api = GoogleDriveAPI()
-            _log(f"✅ [GOOGLE_API] Đã khởi tạo GoogleDriveAPI")
+            sheets_log.info("✅ [GOOGLE_API] Đã khởi tạo GoogleDriveAPI")
         except Exception as api_init_err:
             error_msg = f"❌ Lỗi khởi tạo GoogleDriveAPI: {str(api_init_err)}"
-            _log(f"[API_ERROR] {error_msg}")
+            sheets_log.error("[API_ERROR] %s", error_msg)
             import traceback
-            _log(f"   Traceback: {traceback.format_exc()}")
+            sheets_log.error("   Traceback: %s", traceback.format_exc())
             return (False, error_msg)
         
         # Kiểm tra token
-        _log(f"🔵 [TOKEN_CHECK] Kiểm tra token...")
+        sheets_log.debug("🔵 [TOKEN_CHECK] Kiểm tra token...")
         try:
             token_valid = google_api.ensure_valid_token()
             if not token_valid:
                 error_msg = "❌ Token Google API không hợp lệ hoặc đã hết hạn"
-                _log(f"[TOKEN_ERROR] {error_msg}")
-                _log(f"   💡 Vui lòng chạy: python refresh_token.py để làm mới token")
+                sheets_log.error("[TOKEN_ERROR] %s", error_msg)
+                sheets_log.error("   💡 Vui lòng chạy: python refresh_token.py để làm mới token")
                 return (False, error_msg)
-            _log(f"✅ [TOKEN_VALID] Token hợp lệ")
+            sheets_log.info("✅ [TOKEN_VALID] Token hợp lệ")
         except Exception as token_err:
             error_msg = f"❌ Lỗi kiểm tra token: {str(token_err)}"
-            _log(f"[TOKEN_ERROR] {error_msg}")
+            sheets_log.error("[TOKEN_ERROR] %s", error_msg)
             import traceback
-            _log(f"   Traceback: {traceback.format_exc()}")
+            sheets_log.error("   Traceback: %s", traceback.format_exc())
             return (False, error_msg)
         
         if not google_api.sheets_service:
             error_msg = "❌ Google Sheets service không khả dụng"
-            _log(f"[SERVICE_ERROR] {error_msg}")
+            sheets_log.error("[SERVICE_ERROR] %s", error_msg)
             return (False, error_msg)
         
         # Tìm tháng của ngày attendance
@@ -535,14 +375,14 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
             try:
                 attendance_dt = dt.strptime(attendance_date_str, "%Y-%m-%d")
                 attendance_month = attendance_dt.strftime("%Y%m")
-                _log(f"📅 [MONTH_DETECT] Ngày: {attendance_date_str} → Tháng: {attendance_month}")
+                sheets_log.debug("📅 [MONTH_DETECT] Ngày: %s → Tháng: %s", attendance_date_str, attendance_month)
             except ValueError as date_err:
                 error_msg = f"❌ Lỗi parse ngày: {str(date_err)}"
-                _log(f"[DATE_ERROR] {error_msg}")
+                sheets_log.error("[DATE_ERROR] %s", error_msg)
                 return (False, error_msg)
         
         current_month = attendance_month or dt.now().strftime("%Y%m")
-        _log(f"🔍 [FILE_SEARCH] Tìm file - Team: {employee_team}, Month: {current_month}")
+        sheets_log.debug("🔍 [FILE_SEARCH] Tìm file - Team: %s, Month: %s", employee_team, current_month)
         
         # Tìm file Google Sheet
         try:
@@ -553,26 +393,26 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
             )
         except Exception as find_err:
             error_msg = f"❌ Lỗi khi tìm file: {str(find_err)}"
-            _log(f"[FILE_SEARCH_ERROR] {error_msg}")
+            sheets_log.error("[FILE_SEARCH_ERROR] %s", error_msg)
             import traceback
-            _log(f"   Traceback: {traceback.format_exc()}")
+            sheets_log.error("   Traceback: %s", traceback.format_exc())
             return (False, error_msg)
         
         if not target_file:
             error_msg = f"❌ Không tìm thấy file Google Sheet cho team '{employee_team}' tháng {current_month}"
-            _log(f"[FILE_NOT_FOUND] {error_msg}")
-            _log(f"   ⚠️ Kiểm tra:")
-            _log(f"      1. File có tồn tại trong Google Drive không?")
-            _log(f"      2. Tên file có đúng format không? (ví dụ: {employee_team}_TimeSheet-{current_month})")
-            _log(f"      3. Department mapping trong database có đúng không?")
+            sheets_log.error("[FILE_NOT_FOUND] %s", error_msg)
+            sheets_log.warning("   ⚠️ Kiểm tra:")
+            sheets_log.warning("      1. File có tồn tại trong Google Drive không?")
+            sheets_log.warning("      2. Tên file có đúng format không? (ví dụ: %s_TimeSheet-%s)", employee_team, current_month)
+            sheets_log.warning("      3. Department mapping trong database có đúng không?")
             return (False, error_msg)
         
-        _log(f"✅ [FILE_FOUND] Tìm thấy file: {target_file.get('name', 'N/A')} (ID: {target_file.get('id', 'N/A')})")
+        sheets_log.info("✅ [FILE_FOUND] Tìm thấy file: %s (ID: %s)", target_file.get('name', 'N/A'), target_file.get('id', 'N/A'))
         
         # Cập nhật Google Sheet
-        _log(f"🚀 [SHEET_UPDATE] Đang cập nhật sheet '{employee_id}' trong file...")
-        _log(f"   Spreadsheet ID: {target_file['id']}")
-        _log(f"   Sheet Name: {employee_id}")
+        sheets_log.debug("🚀 [SHEET_UPDATE] Đang cập nhật sheet '%s' trong file...", employee_id)
+        sheets_log.debug("   Spreadsheet ID: %s", target_file['id'])
+        sheets_log.debug("   Sheet Name: %s", employee_id)
         
         try:
             success = google_api.update_timesheet_for_attendance(
@@ -582,64 +422,59 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
             )
             
             if success:
-                _log(f"✅ [SHEET_UPDATE_SUCCESS] Cập nhật thành công!")
-                _log(f"   File: {target_file['name']}")
-                _log(f"   Sheet: {employee_id}")
-                _log(f"   Date: {attendance_data.get('date')}")
-                _log(f"{'='*80}\n")
+                sheets_log.info("✅ [SHEET_UPDATE_SUCCESS] Cập nhật thành công!")
+                sheets_log.debug("   File: %s", target_file['name'])
+                sheets_log.debug("   Sheet: %s", employee_id)
+                sheets_log.debug("   Date: %s", attendance_data.get('date'))
                 
-                # Tạo backup
+                # Yêu cầu backup (được gom, chạy trên thread riêng)
                 try:
-                    create_backup()
-                    _log(f"🛡️ [BACKUP] Đã tạo backup")
+                    request_backup()
+                    sheets_log.debug("🛡️ [BACKUP] Đã yêu cầu backup")
                 except Exception as backup_error:
-                    _log(f"⚠️ [BACKUP_WARNING] Lỗi tạo backup: {backup_error}")
+                    sheets_log.warning("⚠️ [BACKUP_WARNING] Lỗi yêu cầu backup: %s", backup_error)
                 
                 return (True, None)
             else:
                 error_msg = "❌ Cập nhật Google Sheet thất bại (không rõ lý do)"
-                _log(f"[SHEET_UPDATE_FAIL] {error_msg}")
-                _log(f"{'='*80}\n")
+                sheets_log.error("[SHEET_UPDATE_FAIL] %s", error_msg)
                 return (False, error_msg)
                 
         except Exception as update_err:
             error_str = str(update_err)
             error_msg = f"❌ Lỗi khi cập nhật sheet: {error_str}"
-            _log(f"[SHEET_UPDATE_ERROR] {error_msg}")
+            sheets_log.error("[SHEET_UPDATE_ERROR] %s", error_msg)
             import traceback
-            _log(f"   Traceback: {traceback.format_exc()}")
-            _log(f"{'='*80}\n")
+            sheets_log.error("   Traceback: %s", traceback.format_exc())
             
             # Kiểm tra các lỗi phổ biến
             if 'not found' in error_str.lower() or '404' in error_str:
                 error_msg = f"❌ Sheet '{employee_id}' không tồn tại trong file '{target_file.get('name')}'"
-                _log(f"   💡 Vui lòng tạo sheet có tên '{employee_id}' trong file Google Sheet")
+                sheets_log.debug("   💡 Vui lòng tạo sheet có tên '%s' trong file Google Sheet", employee_id)
             elif '429' in error_str or 'quota' in error_str.lower():
                 error_msg = "❌ Vượt quota API Google Sheets (rate limit)"
-                _log(f"   💡 Vui lòng đợi vài phút rồi thử lại")
+                sheets_log.debug("   💡 Vui lòng đợi vài phút rồi thử lại")
             elif 'permission' in error_str.lower() or '403' in error_str:
                 error_msg = "❌ Không có quyền truy cập file Google Sheet"
-                _log(f"   💡 Kiểm tra quyền của token với file này")
+                sheets_log.debug("   💡 Kiểm tra quyền của token với file này")
             
             return (False, error_msg)
     
     except TimeoutException:
         error_msg = f"❌ Timeout sau {timeout_seconds} giây khi cập nhật Google Sheet"
-        _log(f"[TIMEOUT_ERROR] {error_msg}")
-        _log(f"{'='*80}\n")
+        sheets_log.error("[TIMEOUT_ERROR] %s", error_msg)
         return (False, error_msg)
     
     except Exception as e:
         error_msg = f"❌ Lỗi tổng quát: {str(e)}"
         import traceback
         try:
-            _log(f"[CRITICAL_ERROR] {error_msg}")
-            _log(f"   Type: {type(e).__name__}")
-            _log(f"   Traceback:\n{traceback.format_exc()}")
-            _log(f"{'='*80}\n")
+            sheets_log.error("[CRITICAL_ERROR] %s", error_msg)
+            sheets_log.error("   Type: %s", type(e).__name__)
+            sheets_log.error("   Traceback:\n%s", traceback.format_exc())
         except Exception:
             try:
-                print(f"❌ [CRITICAL_ERROR] {error_msg}", flush=True, file=sys.stderr)
+                sheets_log.error("❌ [CRITICAL_ERROR] %s", error_msg)
             except Exception:
                 pass
         return (False, error_msg)
@@ -651,7 +486,8 @@ def update_google_sheet_sync(attendance_id, employee_team, employee_id, attendan
 def batch_update_multi_attendances_sync(attendances_with_data, timeout_seconds=120):
     """
     BATCH UPDATE nhiều attendance records trong 1 lần gọi API.
-    Gom các records theo spreadsheet (department + month) để giảm số lần gọi API.
+    Gom các records theo spreadsheet (department + month) để giảm số lần gọi API;
+    các spreadsheet chạy song song (GOOGLE_SHEETS_SYNC_WORKERS thread, quota API dùng chung).
 
     Args:
         attendances_with_data: List of tuples (attendance, employee_team, employee_id, attendance_data)
@@ -664,19 +500,9 @@ def batch_update_multi_attendances_sync(attendances_with_data, timeout_seconds=1
             'total_api_calls': số lần gọi Google Sheets API
         }
     """
-    import sys
     from datetime import datetime as dt
 
-    def _log(msg):
-        try:
-            print(msg, flush=True, file=sys.stderr)
-        except Exception:
-            pass
-
-    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    _log(f"\n{'='*80}")
-    _log(f"🚀 [BATCH_MULTI_SYNC] {timestamp} - Bắt đầu BATCH UPDATE cho {len(attendances_with_data)} records")
-    _log(f"{'='*80}")
+    sheets_log.debug("🚀 [BATCH_MULTI_SYNC] Bắt đầu BATCH UPDATE cho %s records", len(attendances_with_data))
 
     result = {
         'success_ids': [],
@@ -685,20 +511,20 @@ def batch_update_multi_attendances_sync(attendances_with_data, timeout_seconds=1
     }
 
     if not attendances_with_data:
-        _log("⚠️ [BATCH_MULTI_SYNC] Không có dữ liệu để xử lý")
+        sheets_log.warning("⚠️ [BATCH_MULTI_SYNC] Không có dữ liệu để xử lý")
         return result
 
     try:
         # Khởi tạo Google API một lần
         google_api = GoogleDriveAPI()
         if not google_api.ensure_valid_token():
-            _log("❌ [BATCH_MULTI_SYNC] Token không hợp lệ")
+            sheets_log.error("❌ [BATCH_MULTI_SYNC] Token không hợp lệ")
             for att, _, _, _ in attendances_with_data:
                 result['failed'].append({'id': att.id, 'error': 'Token không hợp lệ'})
             return result
 
         if not google_api.sheets_service:
-            _log("❌ [BATCH_MULTI_SYNC] Sheets service không khả dụng")
+            sheets_log.error("❌ [BATCH_MULTI_SYNC] Sheets service không khả dụng")
             for att, _, _, _ in attendances_with_data:
                 result['failed'].append({'id': att.id, 'error': 'Sheets service không khả dụng'})
             return result
@@ -737,161 +563,189 @@ def batch_update_multi_attendances_sync(attendances_with_data, timeout_seconds=1
                 'attendance_data': attendance_data
             })
 
-        _log(f"📊 [BATCH_MULTI_SYNC] Đã gom thành {len(spreadsheet_groups)} spreadsheet groups")
+        sheets_log.debug("📊 [BATCH_MULTI_SYNC] Đã gom thành %s spreadsheet groups", len(spreadsheet_groups))
         for key, records in spreadsheet_groups.items():
-            _log(f"   - {key[0]} ({key[1]}): {len(records)} records")
+            sheets_log.debug("   - %s (%s): %s records", key[0], key[1], len(records))
+
+        # STEP 2: Xử lý các spreadsheet song song - mỗi thread 1 HTTP client riêng, quota API dùng chung
+        group_items = list(spreadsheet_groups.items())
+        workers = max(1, min(GOOGLE_SHEETS_SYNC_WORKERS, len(group_items)))
+        if workers == 1:
+            group_results = [
+                _sync_attendance_spreadsheet_group(google_api, team, month, records)
+                for (team, month), records in group_items
+            ]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheet-sync') as executor:
+                futures = [
+                    executor.submit(_sync_attendance_spreadsheet_group, google_api.fork(), team, month, records)
+                    for (team, month), records in group_items
+                ]
+                group_results = [future.result() for future in futures]
 
-        # STEP 2: Xử lý từng spreadsheet group
-        for (team, month), records in spreadsheet_groups.items():
-            _log(f"\n📁 [BATCH_MULTI_SYNC] Xử lý: {team} - {month} ({len(records)} records)")
+        for group_result in group_results:
+            result['success_ids'].extend(group_result['success_ids'])
+            result['failed'].extend(group_result['failed'])
+            result['total_api_calls'] += group_result['total_api_calls']
 
-            # Tìm file spreadsheet
-            try:
-                target_file = google_api.find_team_timesheet(
-                    folder_id=GOOGLE_DRIVE_FOLDER_ID,
-                    team_name=team,
-                    month_year=month
-                )
-            except Exception as e:
-                _log(f"❌ [BATCH_MULTI_SYNC] Lỗi tìm file: {e}")
-                for record in records:
-                    result['failed'].append({'id': record['attendance'].id, 'error': f'Lỗi tìm file: {str(e)}'})
-                continue
+        sheets_log.debug("📊 [BATCH_MULTI_SYNC_COMPLETE]")
+        sheets_log.debug("   ✅ Thành công: %s records", len(result['success_ids']))
+        if result['failed']:
+            sheets_log.warning("   ❌ Thất bại: %s records", len(result['failed']))
+        else:
+            sheets_log.info("   ❌ Thất bại: %s records", len(result['failed']))
+        sheets_log.info("   📡 Tổng API calls: %s", result['total_api_calls'])
 
-            if not target_file:
-                _log(f"❌ [BATCH_MULTI_SYNC] Không tìm thấy file cho {team} - {month}")
-                for record in records:
-                    result['failed'].append({'id': record['attendance'].id, 'error': f'Không tìm thấy file cho {team}-{month}'})
-                continue
+        return result
 
-            spreadsheet_id = target_file['id']
-            _log(f"✅ [BATCH_MULTI_SYNC] Tìm thấy file: {target_file.get('name')} (ID: {spreadsheet_id})")
+    except Exception as e:
+        sheets_log.error("❌ [BATCH_MULTI_SYNC] Lỗi tổng quát: %s", e)
+        import traceback
+        sheets_log.error("   Traceback: %s", traceback.format_exc())
+        for att, _, _, _ in attendances_with_data:
+            if att.id not in result['success_ids'] and not any(f['id'] == att.id for f in result['failed']):
+                result['failed'].append({'id': att.id, 'error': f'Lỗi tổng quát: {str(e)}'})
+        return result
 
-            # Lấy danh sách các sheet có trong spreadsheet và populate cache
-            available_sheets_set = set()
-            try:
-                spreadsheet_info = google_api.sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-                sheets_data = spreadsheet_info.get('sheets', [])
-                available_sheets = [sheet['properties']['title'] for sheet in sheets_data]
-                available_sheets_set = set(available_sheets)
-                _log(f"   📋 Các sheet có trong file: {', '.join(available_sheets[:10])}{'...' if len(available_sheets) > 10 else ''}")
-
-                # Populate cache để tránh gọi API lại trong _read_sheet_values
-                for sheet in sheets_data:
-                    title = sheet['properties']['title']
-                    sheet_id = sheet['properties']['sheetId']
-                    cache_key = f"{spreadsheet_id}:{title}"
-                    google_api._sheet_id_cache[cache_key] = sheet_id
-            except Exception as sheet_err:
-                _log(f"   ⚠️ Không thể lấy danh sách sheet: {sheet_err}")
 
-            # STEP 3: Gom records theo employee (sheet) trong spreadsheet
-            employee_groups = {}  # key: employee_id -> list of records
-            for record in records:
-                emp_id = str(record['employee_id'])
-                if emp_id not in employee_groups:
-                    employee_groups[emp_id] = []
-                employee_groups[emp_id].append(record)
+def _sync_attendance_spreadsheet_group(google_api, team, month, records):
+    """
+    Ghi tất cả records của 1 spreadsheet (team + tháng):
+    1 lần batchGet đọc mọi sheet nhân viên cần thiết, 1 lần batch update ghi tất cả.
+    Không ném exception - lỗi được ghi vào 'failed' của từng record.
+    """
+    result = {'success_ids': [], 'failed': [], 'total_api_calls': 0}
 
-            # STEP 4: Xử lý từng employee sheet
-            for employee_id, emp_records in employee_groups.items():
-                _log(f"\n   👤 Employee: {employee_id} ({len(emp_records)} records)")
+    def _fail(recs, error):
+        for record in recs:
+            result['failed'].append({'id': record['attendance'].id, 'error': error})
 
-                # Kiểm tra sheet có tồn tại không trước khi đọc
-                if available_sheets_set and employee_id not in available_sheets_set:
-                    _log(f"   ⚠️ Sheet '{employee_id}' không tồn tại trong file. Cần tạo sheet cho nhân viên này.")
-                    for record in emp_records:
-                        result['failed'].append({'id': record['attendance'].id, 'error': f"Sheet '{employee_id}' không tồn tại - cần tạo sheet"})
-                    continue
+    sheets_log.debug("📁 [BATCH_MULTI_SYNC] Xử lý: %s - %s (%s records)", team, month, len(records))
 
-                # Đọc sheet một lần
-                try:
-                    rows = google_api._read_sheet_values(spreadsheet_id, employee_id)
-                    if not rows:
-                        _log(f"   ⚠️ Không đọc được dữ liệu sheet {employee_id}")
-                        for record in emp_records:
-                            result['failed'].append({'id': record['attendance'].id, 'error': f'Không đọc được sheet {employee_id}'})
-                        continue
-                except Exception as e:
-                    _log(f"   ❌ Lỗi đọc sheet: {e}")
-                    for record in emp_records:
-                        result['failed'].append({'id': record['attendance'].id, 'error': f'Lỗi đọc sheet: {str(e)}'})
-                    continue
+    try:
+        # Tìm file spreadsheet
+        try:
+            target_file = google_api.find_team_timesheet(
+                folder_id=GOOGLE_DRIVE_FOLDER_ID,
+                team_name=team,
+                month_year=month
+            )
+        except Exception as e:
+            sheets_log.error("❌ [BATCH_MULTI_SYNC] Lỗi tìm file: %s", e)
+            _fail(records, f'Lỗi tìm file: {str(e)}')
+            return result
 
-                # Chuẩn bị batch updates cho tất cả records của employee này
-                all_updates = []
-                records_for_update = []
+        if not target_file:
+            sheets_log.error("❌ [BATCH_MULTI_SYNC] Không tìm thấy file cho %s - %s", team, month)
+            _fail(records, f'Không tìm thấy file cho {team}-{month}')
+            return result
 
-                for record in emp_records:
-                    att_data = record['attendance_data']
-                    date_str = att_data.get('date', '')
+        spreadsheet_id = target_file['id']
+        sheets_log.info("✅ [BATCH_MULTI_SYNC] Tìm thấy file: %s (ID: %s)", target_file.get('name'), spreadsheet_id)
 
-                    # Tìm row theo ngày
-                    target_row = google_api._find_row_by_date(rows, date_str, 0)
-                    if not target_row:
-                        _log(f"      ⚠️ Không tìm thấy row cho ngày {date_str}")
-                        result['failed'].append({'id': record['attendance'].id, 'error': f'Không tìm thấy row cho ngày {date_str}'})
-                        continue
+        # Lấy danh sách các sheet có trong spreadsheet và populate cache
+        available_sheets_set = set()
+        try:
+            # Dùng cache metadata chung - chỉ gọi spreadsheets().get khi cache miss
+            sheet_map = google_api.get_sheet_map(spreadsheet_id) or {}
+            # Cache có thể cũ (vừa tạo sheet cho nhân viên mới) -> làm mới 1 lần
+            if sheet_map and any(str(r['employee_id']) not in sheet_map for r in records):
+                sheet_map = google_api.get_sheet_map(spreadsheet_id, force_refresh=True) or sheet_map
+            available_sheets = list(sheet_map.keys())
+            available_sheets_set = set(available_sheets)
+            sheets_log.debug("   📋 Các sheet có trong file (%s, 10 sheet đầu): %s", len(available_sheets), available_sheets[:10])
+        except Exception as sheet_err:
+            sheets_log.warning("   ⚠️ Không thể lấy danh sách sheet: %s", sheet_err)
+
+        # STEP 3: Gom records theo employee (sheet) trong spreadsheet
+        employee_groups = {}  # key: employee_id -> list of records
+        for record in records:
+            emp_id = str(record['employee_id'])
+            if available_sheets_set and emp_id not in available_sheets_set:
+                sheets_log.warning("   ⚠️ Sheet '%s' không tồn tại trong file. Cần tạo sheet cho nhân viên này.", emp_id)
+                _fail([record], f"Sheet '{emp_id}' không tồn tại - cần tạo sheet")
+                continue
+            employee_groups.setdefault(emp_id, []).append(record)
 
-                    # Chuẩn bị updates cho record này
-                    updates = _prepare_batch_updates_for_attendance(
-                        employee_id, target_row, att_data
-                    )
+        if not employee_groups:
+            return result
 
-                    if updates:
-                        all_updates.extend(updates)
-                        records_for_update.append(record)
-                        _log(f"      ✅ Ngày {date_str} -> Row {target_row}: {len(updates)} updates")
+        # STEP 4: Đọc mọi sheet nhân viên bằng 1 lần batchGet
+        try:
+            sheet_rows = google_api.batch_read_sheet_values(spreadsheet_id, list(employee_groups.keys()))
+            result['total_api_calls'] += 1
+        except Exception as e:
+            sheets_log.error("   ❌ Lỗi đọc sheet: %s", e)
+            for emp_records in employee_groups.values():
+                _fail(emp_records, f'Lỗi đọc sheet: {str(e)}')
+            return result
 
-                if not all_updates:
-                    _log(f"   ⚠️ Không có updates cho employee {employee_id}")
+        # Chuẩn bị updates cho tất cả records của spreadsheet
+        all_updates = []
+        records_for_update = []
+
+        for employee_id, emp_records in employee_groups.items():
+            rows = sheet_rows.get(employee_id)
+            if not rows:
+                sheets_log.warning("   ⚠️ Không đọc được dữ liệu sheet %s", employee_id)
+                _fail(emp_records, f'Không đọc được sheet {employee_id}')
+                continue
+
+            sheets_log.debug("   👤 Employee: %s (%s records)", employee_id, len(emp_records))
+            # Chỉ mục ngày -> dòng dựng 1 lần, dùng cho mọi record của sheet này
+            sheet_index = SheetIndex(rows, 0)
+            for record in emp_records:
+                att_data = record['attendance_data']
+                date_str = att_data.get('date', '')
+
+                # Tìm row theo ngày
+                target_row = google_api._find_row_by_date(sheet_index, date_str, 0)
+                if not target_row:
+                    sheets_log.warning("      ⚠️ Không tìm thấy row cho ngày %s", date_str)
+                    _fail([record], f'Không tìm thấy row cho ngày {date_str}')
                     continue
 
-                # STEP 5: Thực hiện batch update cho employee này
-                _log(f"   🚀 Batch update {len(all_updates)} cells cho {employee_id}...")
+                # Chuẩn bị updates cho record này
+                updates = _prepare_batch_updates_for_attendance(
+                    employee_id, target_row, att_data
+                )
 
-                try:
-                    success = google_api.batch_update_values_with_formatting(
-                        spreadsheet_id, str(employee_id), all_updates
-                    )
-                    result['total_api_calls'] += 1
+                if updates:
+                    all_updates.extend(updates)
+                    records_for_update.append(record)
+                    sheets_log.debug("      ✅ Ngày %s -> Row %s: %s updates", date_str, target_row, len(updates))
 
-                    if success:
-                        _log(f"   ✅ Batch update thành công!")
-                        for record in records_for_update:
-                            result['success_ids'].append(record['attendance'].id)
-                    else:
-                        _log(f"   ❌ Batch update thất bại")
-                        for record in records_for_update:
-                            result['failed'].append({'id': record['attendance'].id, 'error': 'Batch update thất bại'})
+        if not all_updates:
+            sheets_log.warning("   ⚠️ Không có updates cho %s - %s", team, month)
+            return result
 
-                except Exception as e:
-                    _log(f"   ❌ Lỗi batch update: {e}")
-                    for record in records_for_update:
-                        result['failed'].append({'id': record['attendance'].id, 'error': f'Lỗi batch update: {str(e)}'})
-
-                # Thêm delay nhỏ giữa các employee để giảm tải API
-                import time
-                time.sleep(0.3)  # 300ms delay giữa mỗi employee
-
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        _log(f"\n{'='*80}")
-        _log(f"📊 [BATCH_MULTI_SYNC_COMPLETE] {timestamp}")
-        _log(f"   ✅ Thành công: {len(result['success_ids'])} records")
-        _log(f"   ❌ Thất bại: {len(result['failed'])} records")
-        _log(f"   📡 Tổng API calls: {result['total_api_calls']}")
-        _log(f"{'='*80}\n")
+        # STEP 5: 1 lần batch update (values + định dạng) cho mọi sheet của spreadsheet
+        sheets_log.debug("   🚀 Batch update %s cells cho %s records...", len(all_updates), len(records_for_update))
+        try:
+            success = google_api.batch_update_values_with_formatting(
+                spreadsheet_id, str(records_for_update[0]['employee_id']), all_updates
+            )
+            result['total_api_calls'] += 1
 
-        return result
+            if success:
+                sheets_log.debug("   ✅ Batch update thành công!")
+                for record in records_for_update:
+                    result['success_ids'].append(record['attendance'].id)
+            else:
+                sheets_log.error("   ❌ Batch update thất bại")
+                _fail(records_for_update, 'Batch update thất bại')
+
+        except Exception as e:
+            sheets_log.error("   ❌ Lỗi batch update: %s", e)
+            _fail(records_for_update, f'Lỗi batch update: {str(e)}')
 
     except Exception as e:
-        _log(f"❌ [BATCH_MULTI_SYNC] Lỗi tổng quát: {e}")
-        import traceback
-        _log(f"   Traceback: {traceback.format_exc()}")
-        for att, _, _, _ in attendances_with_data:
-            if att.id not in result['success_ids'] and not any(f['id'] == att.id for f in result['failed']):
-                result['failed'].append({'id': att.id, 'error': f'Lỗi tổng quát: {str(e)}'})
-        return result
+        sheets_log.error("❌ [BATCH_MULTI_SYNC] Lỗi khi xử lý %s - %s: %s", team, month, e)
+        handled = set(result['success_ids']) | {f['id'] for f in result['failed']}
+        _fail([r for r in records if r['attendance'].id not in handled], f'Lỗi tổng quát: {str(e)}')
+
+    return result
 
 
 def _prepare_batch_updates_for_attendance(sheet_name, row_index, attendance_data):
@@ -996,19 +850,8 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
             'total_api_calls': số lần gọi Google Sheets API
         }
     """
-    import sys
-    from datetime import datetime as dt
 
-    def _log(msg):
-        try:
-            print(msg, flush=True, file=sys.stderr)
-        except Exception:
-            pass
-
-    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    _log(f"\n{'='*80}")
-    _log(f"🚀 [BATCH_LEAVE_SYNC] {timestamp} - Bắt đầu BATCH UPDATE cho {len(leave_requests_with_data)} leave requests")
-    _log(f"{'='*80}")
+    sheets_log.debug("🚀 [BATCH_LEAVE_SYNC] Bắt đầu BATCH UPDATE cho %s leave requests", len(leave_requests_with_data))
 
     result = {
         'success_ids': [],
@@ -1017,20 +860,20 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
     }
 
     if not leave_requests_with_data:
-        _log("⚠️ [BATCH_LEAVE_SYNC] Không có dữ liệu để xử lý")
+        sheets_log.warning("⚠️ [BATCH_LEAVE_SYNC] Không có dữ liệu để xử lý")
         return result
 
     try:
         # Khởi tạo Google API một lần
         google_api = GoogleDriveAPI()
         if not google_api.ensure_valid_token():
-            _log("❌ [BATCH_LEAVE_SYNC] Token không hợp lệ")
+            sheets_log.error("❌ [BATCH_LEAVE_SYNC] Token không hợp lệ")
             for record in leave_requests_with_data:
                 result['failed'].append({'id': record['leave_request'].id, 'error': 'Token không hợp lệ'})
             return result
 
         if not google_api.sheets_service:
-            _log("❌ [BATCH_LEAVE_SYNC] Sheets service không khả dụng")
+            sheets_log.error("❌ [BATCH_LEAVE_SYNC] Sheets service không khả dụng")
             for record in leave_requests_with_data:
                 result['failed'].append({'id': record['leave_request'].id, 'error': 'Sheets service không khả dụng'})
             return result
@@ -1059,7 +902,7 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
             try:
                 daily_leaves = process_leave_requests_for_excel([leave_request])
             except Exception as e:
-                _log(f"   ⚠️ Lỗi phân bổ ngày nghỉ cho đơn #{leave_request.id}: {e}")
+                sheets_log.warning("   ⚠️ Lỗi phân bổ ngày nghỉ cho đơn #%s: %s", leave_request.id, e)
                 result['failed'].append({'id': leave_request.id, 'error': f'Lỗi phân bổ ngày nghỉ: {str(e)}'})
                 continue
 
@@ -1136,10 +979,10 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
 
                 spreadsheet_groups[key][employee_id].append(leave_data)
 
-        _log(f"📊 [BATCH_LEAVE_SYNC] Đã gom thành {len(spreadsheet_groups)} spreadsheet groups")
+        sheets_log.debug("📊 [BATCH_LEAVE_SYNC] Đã gom thành %s spreadsheet groups", len(spreadsheet_groups))
         for key, employees in spreadsheet_groups.items():
             total_updates = sum(len(updates) for updates in employees.values())
-            _log(f"   - {key[0]} ({key[1]}): {len(employees)} employees, {total_updates} updates")
+            sheets_log.debug("   - %s (%s): %s employees, %s updates", key[0], key[1], len(employees), total_updates)
 
         # Track which leave_request_ids have been processed successfully
         successful_leave_ids = set()
@@ -1147,7 +990,7 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
 
         # STEP 2: Xử lý từng spreadsheet group
         for (team, month), employee_groups in spreadsheet_groups.items():
-            _log(f"\n📁 [BATCH_LEAVE_SYNC] Xử lý: {team} - {month}")
+            sheets_log.debug("📁 [BATCH_LEAVE_SYNC] Xử lý: %s - %s", team, month)
 
             # Tìm file spreadsheet
             try:
@@ -1157,49 +1000,45 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
                     month_year=month
                 )
             except Exception as e:
-                _log(f"❌ [BATCH_LEAVE_SYNC] Lỗi tìm file: {e}")
+                sheets_log.error("❌ [BATCH_LEAVE_SYNC] Lỗi tìm file: %s", e)
                 for emp_id, updates in employee_groups.items():
                     for upd in updates:
                         failed_leave_ids[upd['leave_request_id']] = f'Lỗi tìm file: {str(e)}'
                 continue
 
             if not target_file:
-                _log(f"❌ [BATCH_LEAVE_SYNC] Không tìm thấy file cho {team} - {month}")
+                sheets_log.error("❌ [BATCH_LEAVE_SYNC] Không tìm thấy file cho %s - %s", team, month)
                 for emp_id, updates in employee_groups.items():
                     for upd in updates:
                         failed_leave_ids[upd['leave_request_id']] = f'Không tìm thấy file cho {team}-{month}'
                 continue
 
             spreadsheet_id = target_file['id']
-            _log(f"✅ [BATCH_LEAVE_SYNC] Tìm thấy file: {target_file.get('name')} (ID: {spreadsheet_id})")
+            sheets_log.info("✅ [BATCH_LEAVE_SYNC] Tìm thấy file: %s (ID: %s)", target_file.get('name'), spreadsheet_id)
 
             # Lấy danh sách các sheet có trong spreadsheet để debug và populate cache
             available_sheets = []
             available_sheets_set = set()
             try:
-                spreadsheet_info = google_api.sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-                sheets_data = spreadsheet_info.get('sheets', [])
-                available_sheets = [sheet['properties']['title'] for sheet in sheets_data]
+                # Dùng cache metadata chung - chỉ gọi spreadsheets().get khi cache miss
+                sheet_map = google_api.get_sheet_map(spreadsheet_id) or {}
+                # Cache có thể cũ (vừa tạo sheet cho nhân viên mới) -> làm mới 1 lần
+                if sheet_map and any(str(emp_id) not in sheet_map for emp_id in employee_groups):
+                    sheet_map = google_api.get_sheet_map(spreadsheet_id, force_refresh=True) or sheet_map
+                available_sheets = list(sheet_map.keys())
                 available_sheets_set = set(available_sheets)
-                _log(f"   📋 Các sheet có trong file: {', '.join(available_sheets[:10])}{'...' if len(available_sheets) > 10 else ''}")
-
-                # Populate cache để tránh gọi API lại trong _read_sheet_values
-                for sheet in sheets_data:
-                    title = sheet['properties']['title']
-                    sheet_id = sheet['properties']['sheetId']
-                    cache_key = f"{spreadsheet_id}:{title}"
-                    google_api._sheet_id_cache[cache_key] = sheet_id
+                sheets_log.debug("   📋 Các sheet có trong file (%s, 10 sheet đầu): %s", len(available_sheets), available_sheets[:10])
             except Exception as sheet_err:
-                _log(f"   ⚠️ Không thể lấy danh sách sheet: {sheet_err}")
+                sheets_log.warning("   ⚠️ Không thể lấy danh sách sheet: %s", sheet_err)
 
             # STEP 3: Xử lý từng employee sheet
             for employee_id, emp_updates in employee_groups.items():
-                _log(f"\n   👤 Employee: {employee_id} ({len(emp_updates)} updates)")
+                sheets_log.debug("   👤 Employee: %s (%s updates)", employee_id, len(emp_updates))
 
                 # Kiểm tra sheet có tồn tại không trước khi đọc
                 employee_id_str = str(employee_id)
                 if available_sheets_set and employee_id_str not in available_sheets_set:
-                    _log(f"   ⚠️ Sheet '{employee_id_str}' không tồn tại trong file. Cần tạo sheet cho nhân viên này.")
+                    sheets_log.warning("   ⚠️ Sheet '%s' không tồn tại trong file. Cần tạo sheet cho nhân viên này.", employee_id_str)
                     for upd in emp_updates:
                         failed_leave_ids[upd['leave_request_id']] = f"Sheet '{employee_id_str}' không tồn tại - cần tạo sheet"
                     continue
@@ -1208,12 +1047,12 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
                 try:
                     rows = google_api._read_sheet_values(spreadsheet_id, employee_id_str)
                     if not rows:
-                        _log(f"   ⚠️ Không đọc được dữ liệu sheet {employee_id}")
+                        sheets_log.warning("   ⚠️ Không đọc được dữ liệu sheet %s", employee_id)
                         for upd in emp_updates:
                             failed_leave_ids[upd['leave_request_id']] = f'Không đọc được sheet {employee_id}'
                         continue
                 except Exception as e:
-                    _log(f"   ❌ Lỗi đọc sheet: {e}")
+                    sheets_log.error("   ❌ Lỗi đọc sheet: %s", e)
                     for upd in emp_updates:
                         failed_leave_ids[upd['leave_request_id']] = f'Lỗi đọc sheet: {str(e)}'
                     continue
@@ -1221,14 +1060,15 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
                 # Chuẩn bị batch updates
                 all_updates = []
                 updates_mapping = []  # Track which leave_request_id each update belongs to
+                sheet_index = SheetIndex(rows, 0)  # Dựng 1 lần cho mọi ngày nghỉ của nhân viên
 
                 for leave_data in emp_updates:
                     date_str = leave_data.get('date', '')
 
                     # Tìm row theo ngày
-                    target_row = google_api._find_row_by_date(rows, date_str, 0)
+                    target_row = google_api._find_row_by_date(sheet_index, date_str, 0)
                     if not target_row:
-                        _log(f"      ⚠️ Không tìm thấy row cho ngày {date_str}")
+                        sheets_log.warning("      ⚠️ Không tìm thấy row cho ngày %s", date_str)
                         failed_leave_ids[leave_data['leave_request_id']] = f'Không tìm thấy row cho ngày {date_str}'
                         continue
 
@@ -1243,14 +1083,14 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
                             'leave_request_id': leave_data['leave_request_id'],
                             'update_count': len(updates)
                         })
-                        _log(f"      ✅ Ngày {date_str} -> Row {target_row}: {len(updates)} updates")
+                        sheets_log.debug("      ✅ Ngày %s -> Row %s: %s updates", date_str, target_row, len(updates))
 
                 if not all_updates:
-                    _log(f"   ⚠️ Không có updates cho employee {employee_id}")
+                    sheets_log.warning("   ⚠️ Không có updates cho employee %s", employee_id)
                     continue
 
                 # STEP 4: Thực hiện batch update cho employee này
-                _log(f"   🚀 Batch update {len(all_updates)} cells cho {employee_id}...")
+                sheets_log.debug("   🚀 Batch update %s cells cho %s...", len(all_updates), employee_id)
 
                 try:
                     success = google_api.batch_update_values_with_formatting(
@@ -1259,16 +1099,16 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
                     result['total_api_calls'] += 1
 
                     if success:
-                        _log(f"   ✅ Batch update thành công!")
+                        sheets_log.debug("   ✅ Batch update thành công!")
                         for mapping in updates_mapping:
                             successful_leave_ids.add(mapping['leave_request_id'])
                     else:
-                        _log(f"   ❌ Batch update thất bại")
+                        sheets_log.error("   ❌ Batch update thất bại")
                         for mapping in updates_mapping:
                             failed_leave_ids[mapping['leave_request_id']] = 'Batch update thất bại'
 
                 except Exception as e:
-                    _log(f"   ❌ Lỗi batch update: {e}")
+                    sheets_log.error("   ❌ Lỗi batch update: %s", e)
                     for mapping in updates_mapping:
                         failed_leave_ids[mapping['leave_request_id']] = f'Lỗi batch update: {str(e)}'
 
@@ -1283,20 +1123,20 @@ def batch_update_multi_leave_requests_sync(leave_requests_with_data, timeout_sec
                 # Not processed at all (shouldn't happen, but just in case)
                 result['failed'].append({'id': lr_id, 'error': 'Không được xử lý'})
 
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        _log(f"\n{'='*80}")
-        _log(f"📊 [BATCH_LEAVE_SYNC_COMPLETE] {timestamp}")
-        _log(f"   ✅ Thành công: {len(result['success_ids'])} leave requests")
-        _log(f"   ❌ Thất bại: {len(result['failed'])} leave requests")
-        _log(f"   📡 Tổng API calls: {result['total_api_calls']}")
-        _log(f"{'='*80}\n")
+        sheets_log.debug("📊 [BATCH_LEAVE_SYNC_COMPLETE]")
+        sheets_log.debug("   ✅ Thành công: %s leave requests", len(result['success_ids']))
+        if result['failed']:
+            sheets_log.warning("   ❌ Thất bại: %s leave requests", len(result['failed']))
+        else:
+            sheets_log.info("   ❌ Thất bại: %s leave requests", len(result['failed']))
+        sheets_log.info("   📡 Tổng API calls: %s", result['total_api_calls'])
 
         return result
 
     except Exception as e:
-        _log(f"❌ [BATCH_LEAVE_SYNC] Lỗi tổng quát: {e}")
+        sheets_log.error("❌ [BATCH_LEAVE_SYNC] Lỗi tổng quát: %s", e)
         import traceback
-        _log(f"   Traceback: {traceback.format_exc()}")
+        sheets_log.error("   Traceback: %s", traceback.format_exc())
         for record in leave_requests_with_data:
             lr_id = record['leave_request'].id
             if lr_id not in result['success_ids'] and not any(f['id'] == lr_id for f in result['failed']):
@@ -1367,13 +1207,6 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
     from datetime import datetime as dt, timedelta
     import signal
     
-    def _log(msg):
-        """Helper function for logging"""
-        try:
-            print(msg, flush=True, file=sys.stderr)
-        except Exception:
-            pass
-    
     # Handler cho timeout
     class TimeoutException(Exception):
         pass
@@ -1381,12 +1214,9 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
     def timeout_handler(signum, frame):
         raise TimeoutException("Google Sheet update timeout")
     
-    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    _log(f"\n{'='*80}")
-    _log(f"🔵 [SYNC_LEAVE_SHEET_UPDATE] {timestamp} - Bắt đầu cập nhật ĐỒNG BỘ Đơn Nghỉ Phép")
-    _log(f"   Leave Request ID: {leave_request.id}")
-    _log(f"   Employee: {leave_request.employee_name}")
-    _log(f"{'='*80}")
+    sheets_log.debug("🔵 [SYNC_LEAVE_SHEET_UPDATE] Bắt đầu cập nhật ĐỒNG BỘ Đơn Nghỉ Phép")
+    sheets_log.debug("   Leave Request ID: %s", leave_request.id)
+    sheets_log.debug("   Employee: %s", leave_request.employee_name)
     
     try:
         # Lấy app context
@@ -1396,7 +1226,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
         
         if flask_app is None:
             error_msg = "❌ Flask app chưa được khởi tạo"
-            _log(f"[APP_ERROR] {error_msg}")
+            sheets_log.error("[APP_ERROR] %s", error_msg)
             return (False, error_msg)
         
         with flask_app.app_context():
@@ -1405,7 +1235,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
                 google_api = GoogleDriveAPI()
             except Exception as api_init_err:
                 error_msg = f"❌ Lỗi khởi tạo GoogleDriveAPI: {str(api_init_err)}"
-                _log(f"[API_ERROR] {error_msg}")
+                sheets_log.error("[API_ERROR] %s", error_msg)
                 return (False, error_msg)
             
             # Kiểm tra token
@@ -1413,11 +1243,11 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
                 token_valid = google_api.ensure_valid_token()
                 if not token_valid:
                     error_msg = "❌ Token Google API không hợp lệ"
-                    _log(f"[TOKEN_ERROR] {error_msg}")
+                    sheets_log.error("[TOKEN_ERROR] %s", error_msg)
                     return (False, error_msg)
             except Exception as token_err:
                 error_msg = f"❌ Lỗi kiểm tra token: {str(token_err)}"
-                _log(f"[TOKEN_ERROR] {error_msg}")
+                sheets_log.error("[TOKEN_ERROR] %s", error_msg)
                 return (False, error_msg)
             
             # Lấy thông tin user để biết team/department
@@ -1428,7 +1258,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
             
             if not user:
                 error_msg = f"❌ Không tìm thấy user ID {leave_request.user_id}"
-                _log(f"[USER_ERROR] {error_msg}")
+                sheets_log.error("[USER_ERROR] %s", error_msg)
                 return (False, error_msg)
                 
             employee_id = user.employee_id
@@ -1436,12 +1266,12 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
             
             if not employee_id:
                 error_msg = f"❌ User {user.name} không có employee_id"
-                _log(f"[VALIDATION_ERROR] {error_msg}")
+                sheets_log.error("[VALIDATION_ERROR] %s", error_msg)
                 return (False, error_msg)
             
             if not employee_team or employee_team == "Unknown":
                 error_msg = f"❌ User {user.name} chưa cập nhật Department (Team)"
-                _log(f"[VALIDATION_ERROR] {error_msg}")
+                sheets_log.error("[VALIDATION_ERROR] %s", error_msg)
                 return (False, error_msg)
                 
             # Xác định khoảng thời gian nghỉ
@@ -1457,7 +1287,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
             daily_leaves = process_leave_requests_for_excel([leave_request])
             
             if not daily_leaves:
-                _log(f"⚠️ Không thể phân bổ ngày nghỉ cho đơn #{leave_request.id}")
+                sheets_log.warning("⚠️ Không thể phân bổ ngày nghỉ cho đơn #%s", leave_request.id)
                 return (False, "Lỗi phân bổ ngày nghỉ")
 
             total_days = len(daily_leaves)
@@ -1469,7 +1299,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
                 date_obj = day_data['date'] # date object
                 date_str = date_obj.strftime('%Y-%m-%d')
                 
-                _log(f"👉 [DATE_PROCESS] Xử lý ngày {date_str} ({processed_count}/{total_days})")
+                sheets_log.debug("👉 [DATE_PROCESS] Xử lý ngày %s (%s/%s)", date_str, processed_count, total_days)
 
                 # Format text hiển thị cho ngày này
                 leave_type_info = day_data.get('leave_type', {})
@@ -1521,14 +1351,14 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
                     except Exception:
                         pass
                 
-                _log(f"   📊 [HALF_DAY_INFO] shift_code={effective_shift_code}, leave_start={leave_start_time_str}, leave_end={leave_end_time_str}")
+                sheets_log.debug("   📊 [HALF_DAY_INFO] shift_code=%s, leave_start=%s, leave_end=%s", effective_shift_code, leave_start_time_str, leave_end_time_str)
                 
                 # Detect Japanese/Scope Holiday to avoid clearing columns
                 type_name_lower = type_name.lower()
                 is_memo_leave = False
                 if "nghỉ lễ nhật" in type_name_lower or "scope" in type_name_lower:
                     is_memo_leave = True
-                    _log(f"   ℹ️ Phát hiện nghỉ đặc biệt (Lễ Nhật/Scope) -> Chế độ Memo Only (Không xóa/ghi đè cột thời gian)")
+                    sheets_log.debug("   ℹ️ Phát hiện nghỉ đặc biệt (Lễ Nhật/Scope) -> Chế độ Memo Only (Không xóa/ghi đè cột thời gian)")
 
                 # Chuẩn bị data cho ngày này
                 sheet_data = {
@@ -1557,7 +1387,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
                     )
                     
                     if not target_file:
-                        _log(f"   ⚠️ Không tìm thấy file sheet cho team {employee_team} tháng {attendance_month}")
+                        sheets_log.warning("   ⚠️ Không tìm thấy file sheet cho team %s tháng %s", employee_team, attendance_month)
                         error_msg = f"Không tìm thấy file Sheet tháng {attendance_month}"
                         continue 
 
@@ -1571,12 +1401,12 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
                     if success:
                         success_count += 1
                     else:
-                        _log(f"   ❌ Update thất bại cho ngày {date_str}")
+                        sheets_log.error("   ❌ Update thất bại cho ngày %s", date_str)
                         
                 except Exception as loop_err:
-                    _log(f"   ❌ Lỗi xử lý ngày {date_str}: {loop_err}")
+                    sheets_log.error("   ❌ Lỗi xử lý ngày %s: %s", date_str, loop_err)
                 
-            _log(f"✅ [SYNC_LEAVE_FINISH] Hoàn tất. Thành công {success_count}/{total_days} ngày.")
+            sheets_log.info("✅ [SYNC_LEAVE_FINISH] Hoàn tất. Thành công %s/%s ngày.", success_count, total_days)
             
             if success_count > 0:
                 return (True, None) # Coi như thành công nếu update được ít nhất 1 ngày
@@ -1586,7 +1416,7 @@ def update_leave_sheet_sync(leave_request, timeout_seconds=60):
     except Exception as e:
         error_msg = f"❌ Lỗi tổng quát Sync Leave: {str(e)}"
         import traceback
-        _log(f"[CRITICAL_ERROR] {error_msg}\n{traceback.format_exc()}")
+        sheets_log.error("[CRITICAL_ERROR] %s\n%s", error_msg, traceback.format_exc())
         return (False, error_msg)
 
 
@@ -1608,62 +1438,19 @@ except Exception:
 # Các lệnh print trong app có thể ném ValueError: I/O operation on closed file.
 # Để tránh crash 500, bọc print bằng hàm an toàn.
 
-# Pre-cache references để tránh import/access gây lỗi
-import builtins as _builtins
-_sys_module = sys
-
-def _safe_print(*args, **kwargs):
-    """Ultra-safe print wrapper. Silently ignores ALL errors to prevent 500."""
-    try:
-        # Kiểm tra stream validity
-        def is_valid(stream):
-            try:
-                return (stream is not None and 
-                        hasattr(stream, 'write') and 
-                        hasattr(stream, 'flush') and
-                        not stream.closed)
-            except:
-                return False
-        
-        # Tìm stream hợp lệ
-        target = kwargs.get('file', _sys_module.stdout)
-        stream = None
-        
-        if is_valid(target):
-            stream = target
-        elif is_valid(_sys_module.stdout):
-            stream = _sys_module.stdout
-        elif is_valid(_sys_module.stderr):
-            stream = _sys_module.stderr
-        
-        # Không có stream hợp lệ -> bỏ qua
-        if stream is None:
-            return
-        
-        # Update kwargs
-        kwargs['file'] = stream
-        
-        # Test flush trước khi dùng
-        if kwargs.get('flush', False):
-            try:
-                stream.flush()
-            except:
-                kwargs['flush'] = False
-        
-        # Gọi print
-        _builtins.print(*args, **kwargs)
-    except:
-        # BẤT KỲ LỖI NÀO -> im lặng hoàn toàn
-        pass
+# print trong app đi qua pipeline log không chặn (utils/log_pipeline.py): không flush đồng bộ,
+# stream bị đóng không làm crash request, level tắt thì không format / không ghi
+from utils.log_pipeline import (
+    setup_logging, log_pipeline, log_print, sheets_log, approval_log, license_log, chatbot_log, export_log,
+)
 
-print = _safe_print
+setup_logging()
+_safe_print = log_print
+print = log_print
 
 # Import các thư viện cần thiết
 try:
     from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, get_flashed_messages, abort, send_file, make_response
-    from openpyxl import Workbook, load_workbook
-    from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-    from openpyxl.utils import get_column_letter
     from flask_login import LoginManager, login_user, login_required, logout_user, current_user
     from flask_wtf import CSRFProtect
     from flask_wtf.csrf import generate_csrf
@@ -1686,22 +1473,31 @@ import json
 import uuid
 from functools import wraps
 from config import config
-from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm import joinedload, selectinload, defer
 from sqlalchemy import func, text
 import re
 # import pickle  # Security improvement: Removed pickle
 import time as time_module
 
-# Import Google API libraries
-try:
-    from google.oauth2.credentials import Credentials
-    from google_auth_oauthlib.flow import InstalledAppFlow
-    from google.auth.transport.requests import Request as GoogleRequest
-    from googleapiclient.discovery import build
-    from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-    GOOGLE_API_AVAILABLE = True
-except ImportError:
-    GOOGLE_API_AVAILABLE = False
+# Thư viện nặng chỉ vài route dùng -> nạp lười ở lần dùng đầu tiên (xem utils/lazy_imports.py)
+# openpyxl (import/export Excel)
+Workbook = lazy('openpyxl', 'Workbook')
+load_workbook = lazy('openpyxl', 'load_workbook')
+Font = lazy('openpyxl.styles', 'Font')
+Alignment = lazy('openpyxl.styles', 'Alignment')
+PatternFill = lazy('openpyxl.styles', 'PatternFill')
+Border = lazy('openpyxl.styles', 'Border')
+Side = lazy('openpyxl.styles', 'Side')
+get_column_letter = lazy('openpyxl.utils', 'get_column_letter')
+
+# Import Google API libraries (chỉ kiểm tra đã cài, chưa import)
+GOOGLE_API_AVAILABLE = all(module_available(name) for name in ('googleapiclient', 'google_auth_oauthlib', 'google.auth'))
+if GOOGLE_API_AVAILABLE:
+    Credentials = lazy('google.oauth2.credentials', 'Credentials')
+    InstalledAppFlow = lazy('google_auth_oauthlib.flow', 'InstalledAppFlow')
+    GoogleRequest = lazy('google.auth.transport.requests', 'Request')
+    build = lazy('googleapiclient.discovery', 'build')
+else:
     print("Google API libraries not available. Running in demo mode.")
 
 # Phạm vi quyền truy cập Google API
@@ -1762,34 +1558,24 @@ def get_required_daily_hours(user, target_date=None, holiday_type=None, shift_co
         return 8.0
     return base_hours
 
-from collections import defaultdict
 import secrets
 from flask_migrate import Migrate
 from jinja2 import Template
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib import colors
+# reportlab (PDF giấy tăng ca / chữ ký) - nạp lười; A4 import trong từng hàm vẽ PDF
+canvas = lazy('reportlab.pdfgen.canvas')
+ImageReader = lazy('reportlab.lib.utils', 'ImageReader')
+TTFont = lazy('reportlab.pdfbase.ttfonts', 'TTFont')
+colors = lazy('reportlab.lib.colors')
 import base64
 import traceback
-from reportlab.platypus import Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import mm
-from reportlab.pdfbase.pdfmetrics import registerFont
-import zipfile
+Table = lazy('reportlab.platypus', 'Table')
+TableStyle = lazy('reportlab.platypus', 'TableStyle')
+Paragraph = lazy('reportlab.platypus', 'Paragraph')
+ParagraphStyle = lazy('reportlab.lib.styles', 'ParagraphStyle')
+registerFont = lazy('reportlab.pdfbase.pdfmetrics', 'registerFont')
 import webbrowser
 import subprocess
 import platform
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
-from webdriver_manager.chrome import ChromeDriverManager
 
 
 # License / activation
@@ -1920,14 +1706,13 @@ from database.models import (
     LeaveRequest,
     Holiday,
     Activation,
+    normalize_department,
 )
-import smtplib
 from email.mime.text import MIMEText
 from email.utils import formataddr
 from email.header import Header
 from utils.email_utils import send_leave_request_email, send_leave_request_email_async
 from state.email_state import email_status
-from queue import Queue
 from sqlalchemy.exc import SQLAlchemyError
 
 # Import utility functions
@@ -1950,6 +1735,26 @@ from utils.signature_manager import signature_manager
 from utils.logger import logger, security_logger, audit_logger, database_logger, api_logger
 from utils.security import security_manager, require_security_check
 from utils.database_utils import safe_db_commit, safe_db_rollback, retry_db_operation
+from utils.drive_metadata_cache import drive_metadata_cache
+from utils.overtime_pdf_bulk import BulkPdfEntry, BulkPdfRenderer, stream_zip
+from utils.overtime_pdf import (
+    create_overtime_pdf, create_signature_placeholder, debug_signature_data, draw_signature_with_proper_scaling,
+    init_render_worker, register_pdf_fonts, wrap_text,
+)
+from utils.signature_image_cache import signature_image_cache
+from utils.sse_broker import sse_broker, iter_sse_stream
+from utils.activation_state import activation_state, ActivationSnapshot
+from utils.holiday_calendar import holiday_calendar
+from utils.pending_counters import LEAVE as PENDING_LEAVE, pending_counters
+from utils.query_optimizer import attach_count_cache_invalidation
+from utils.session_store import init_session_store
+from utils.sqlite_tuning import install_sqlite_pragmas, read_sqlite_pragmas
+from utils.report_snapshot import report_snapshot, backup_sqlite_database
+from utils.sheet_sync_outbox import sheet_sync_outbox
+from utils.email_outbox import KIND_PASSWORD_RESET, email_outbox, email_status_channel
+from utils.google_quota import google_quota, GOOGLE_SHEETS_SYNC_WORKERS
+from utils.sheet_index import SheetIndex, TIMESHEET_READ_RANGE
+from utils.shift_engine import ShiftInput, compute_work_hours
 
 def has_role(user_id, required_role):
     """Check if user has a specific role"""
@@ -2079,34 +1884,24 @@ def validate_overtime_comp_time(
     if total_comp_minutes > total_work_minutes:
         return False, "Tổng đối ứng không được vượt quá tổng giờ làm."
 
-    # Compute available overtime before/after 22h using existing business logic in Attendance.update_work_hours(),
-    # but with compensation minutes set to 0 so we get raw available OT.
+    # Compute available overtime before/after 22h with the shared shift engine (same rules as
+    # Attendance.update_work_hours()), with compensation minutes set to 0 so we get raw available OT.
     try:
-        tmp = Attendance(
-            user_id=session.get('user_id') or 0,
+        result = compute_work_hours(ShiftInput(
             date=date,
-            break_time=break_time or 0.0,
-            is_holiday=(holiday_type != 'normal'),
-            holiday_type=holiday_type,
-            status='pending',
+            check_in=ci_dt,
+            check_out=co_dt,
             shift_code=shift_code,
             shift_start=shift_start,
             shift_end=shift_end,
-            comp_time_regular_minutes=0,
-            comp_time_overtime_minutes=0,
-            comp_time_ot_before_22_minutes=0,
-            comp_time_ot_after_22_minutes=0,
-            overtime_comp_time_minutes=0,
+            holiday_type=holiday_type,
+            break_time=break_time or 0.0,
+            break_time_minutes=None,
             required_hours=8.0,
-        )
-        tmp.check_in = ci_dt
-        tmp.check_out = co_dt
-        tmp.update_work_hours()
+        ))
 
-        # Giờ công thường (regular_work_hours) được Attendance tính theo chính sách hiện tại
-        regular_minutes = hhmm_to_minutes(
-            tmp._Attendance__dict__.get('regular_work_hours_hhmm')  # not present, fallback below
-        ) if False else int(round((tmp.regular_work_hours or 0.0) * 60))
+        # Giờ công thường (regular_work_hours) được tính theo chính sách hiện tại
+        regular_minutes = int(round((result.regular_work_hours or 0.0) * 60))
 
         # Ca 5: không có giờ công => đối ứng trong ca phải = 0
         if shift_code == '5' and comp_regular_minutes > 0 and holiday_type != 'vietnamese_holiday':
@@ -2114,8 +1909,8 @@ def validate_overtime_comp_time(
         if comp_regular_minutes > regular_minutes and holiday_type not in ['weekend', 'vietnamese_holiday']:
             return False, "Đối ứng trong ca không được lớn hơn giờ công."
 
-        ot_before_raw = hhmm_to_minutes(tmp.overtime_before_22 or "0:00")
-        ot_after_raw = hhmm_to_minutes(tmp.overtime_after_22 or "0:00")
+        ot_before_raw = hhmm_to_minutes(result.overtime_before_22 or "0:00")
+        ot_after_raw = hhmm_to_minutes(result.overtime_after_22 or "0:00")
 
         if comp_before22_minutes > ot_before_raw:
             return False, "Đối ứng tăng ca trước 22h không được lớn hơn giờ tăng ca trước 22h."
@@ -2253,6 +2048,11 @@ def upsert_email_status(request_id: int, status: str, message: str):
         db.session.rollback()
         # print(f"[EmailStatus] upsert error: {e}")
 
+def record_email_status(request_id: int, status: str, message: str):
+    """Trạng thái email do outbox báo về (utils/email_outbox.py): global email_status + DB"""
+    email_status[request_id] = {'status': status, 'message': message, 'timestamp': time_module.time()}
+    upsert_email_status(request_id, status, message)
+
 def get_email_status_record(request_id: int):
     try:
         _ensure_email_status_table()
@@ -2282,7 +2082,7 @@ def get_google_api_singleton():
         with _google_api_lock:
             if _google_api_instance is None:
                 _google_api_instance = GoogleDriveAPI(auto_authenticate=True)
-                print("🔌 [CONNECTION_POOL] Đã tạo Google API singleton instance", flush=True, file=sys.stderr)
+                sheets_log.debug("🔌 [CONNECTION_POOL] Đã tạo Google API singleton instance")
 
     # Đảm bảo token vẫn valid
     if _google_api_instance and _google_api_instance.creds:
@@ -2290,9 +2090,9 @@ def get_google_api_singleton():
             with _google_api_lock:
                 try:
                     _google_api_instance.ensure_valid_token()
-                    print("🔄 [CONNECTION_POOL] Đã refresh token cho singleton", flush=True, file=sys.stderr)
+                    sheets_log.debug("🔄 [CONNECTION_POOL] Đã refresh token cho singleton")
                 except Exception as e:
-                    print(f"⚠️ [CONNECTION_POOL] Lỗi refresh token: {e}", flush=True, file=sys.stderr)
+                    sheets_log.warning("⚠️ [CONNECTION_POOL] Lỗi refresh token: %s", e)
 
     return _google_api_instance
 
@@ -2324,13 +2124,13 @@ class GoogleDriveAPI:
         self.last_refresh_file = 'last_token_refresh.txt'
         
         if not GOOGLE_API_AVAILABLE:
-            print("Lỗi: Google API libraries không có sẵn!")
-            print("Hãy cài đặt: pip install google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
+            sheets_log.error("Lỗi: Google API libraries không có sẵn!")
+            sheets_log.debug("Hãy cài đặt: pip install google-auth google-auth-oauthlib google-auth-httplib2 google-api-python-client")
             return
         
         if not os.path.exists('credentials.json'):
-            print("Lỗi: Không tìm thấy file credentials.json!")
-            print("Hãy tạo file credentials.json trong thư mục hiện tại.")
+            sheets_log.error("Lỗi: Không tìm thấy file credentials.json!")
+            sheets_log.debug("Hãy tạo file credentials.json trong thư mục hiện tại.")
             return
         
         # Chỉ load token từ file nếu không auto-authenticate
@@ -2341,26 +2141,21 @@ class GoogleDriveAPI:
                         token_data = json.load(token)
                         self.creds = Credentials.from_authorized_user_info(token_data, GOOGLE_SCOPES)
                 except Exception as e:
-                    print(f"Lỗi khi load token.json: {e}")
+                    sheets_log.error("Lỗi khi load token.json: %s", e)
             # Removed pickle migration code for security - only JSON is supported now
             return
         
         # Chỉ authenticate nếu được phép và cần thiết
         if auto_authenticate:
-            print("Phát hiện file credentials.json - Bắt đầu xác thực...")
+            sheets_log.debug("Phát hiện file credentials.json - Bắt đầu xác thực...")
             self.authenticate(allow_browser_auth=False)  # Không tự động mở browser
             
             # Tự động gia hạn token nếu cần
             self.auto_refresh_token_if_needed()
         
-        # Cache cho file ID để tránh tìm kiếm nhiều lần
-        self._file_cache = {}
-        # Cache cho sheet ID để tránh gọi API lặp lại (giảm rate limit)
-        self._sheet_id_cache = {}
-        # Rate limit tracking
-        self._api_call_timestamps = []
-        self._rate_limit_window = 60  # 60 giây
-        self._rate_limit_max_calls = 55  # Giới hạn 55 (dưới ngưỡng 60 của Google)
+        # Cache file ID / sheet ID dùng chung cho mọi instance (xem utils/drive_metadata_cache.py)
+        self._metadata_cache = drive_metadata_cache
+        # Rate limit: quota chung cho mọi instance / thread (xem utils/google_quota.py)
     
     def authenticate(self, allow_browser_auth=False):
         """Xác thực với Google API
@@ -2370,7 +2165,7 @@ class GoogleDriveAPI:
                                Nếu False, chỉ thử refresh token, không mở browser.
         """
         if not GOOGLE_API_AVAILABLE:
-            print("Google API libraries not available")
+            sheets_log.debug("Google API libraries not available")
             return
             
         try:
@@ -2402,7 +2197,7 @@ class GoogleDriveAPI:
                                 token.write(self.creds.to_json())
                         else:
                             # Không mở browser, chỉ báo lỗi
-                            print(f"⚠️ Token hết hạn và không thể refresh tự động. Cần authenticate thủ công.")
+                            sheets_log.warning("⚠️ Token hết hạn và không thể refresh tự động. Cần authenticate thủ công.")
                             return  # Không raise exception để không làm crash app
                 elif allow_browser_auth:
                     # Chỉ mở browser nếu được phép và không có token
@@ -2414,16 +2209,16 @@ class GoogleDriveAPI:
                         token.write(self.creds.to_json())
                 else:
                     # Không có token và không được phép mở browser
-                    print("⚠️ Không có token và không được phép mở browser để authenticate.")
+                    sheets_log.warning("⚠️ Không có token và không được phép mở browser để authenticate.")
                     return  # Không raise exception để không làm crash app
             
             # Khởi tạo services nếu có credentials
             if self.creds and self.creds.valid:
                 self.drive_service = build('drive', 'v3', credentials=self.creds)
                 self.sheets_service = build('sheets', 'v4', credentials=self.creds)
-                print("✅ Xác thực thành công!")
+                sheets_log.info("✅ Xác thực thành công!")
         except Exception as e:
-            print(f"⚠️ Lỗi xác thực: {e}")
+            sheets_log.warning("⚠️ Lỗi xác thực: %s", e)
             # Không crash app, chỉ log lỗi
     
     def auto_refresh_token_if_needed(self):
@@ -2431,28 +2226,28 @@ class GoogleDriveAPI:
         try:
             # Kiểm tra xem có cần gia hạn không
             if self.should_refresh_token():
-                print("🔄 Tự động gia hạn token...")
+                sheets_log.debug("🔄 Tự động gia hạn token...")
                 if self.refresh_token():
                     self.save_last_refresh_time()
-                    print("✅ Token đã được gia hạn thành công!")
+                    sheets_log.info("✅ Token đã được gia hạn thành công!")
                 else:
-                    print("⚠️ Không thể gia hạn token, cần xác thực lại")
+                    sheets_log.warning("⚠️ Không thể gia hạn token, cần xác thực lại")
             else:
-                print("✅ Token vẫn còn hiệu lực, không cần gia hạn")
+                sheets_log.info("✅ Token vẫn còn hiệu lực, không cần gia hạn")
         except Exception as e:
-            print(f"⚠️  Lỗi khi gia hạn token: {e}")
+            sheets_log.warning("⚠️  Lỗi khi gia hạn token: %s", e)
     
     def ensure_valid_token(self):
         """Đảm bảo token luôn hợp lệ trước khi sử dụng API"""
         try:
             # Kiểm tra xem có credentials không
             if not self.creds:
-                print("❌ Không có credentials, cần xác thực lại")
+                sheets_log.error("❌ Không có credentials, cần xác thực lại")
                 return False
             
             # Kiểm tra xem token có hết hạn không
             if self.creds.expired:
-                print("🔄 Token đã hết hạn, đang gia hạn...")
+                sheets_log.debug("🔄 Token đã hết hạn, đang gia hạn...")
                 if self.creds.refresh_token:
                     try:
                         self.creds.refresh(GoogleRequest())
@@ -2462,39 +2257,39 @@ class GoogleDriveAPI:
                         # Cập nhật services
                         self.drive_service = build('drive', 'v3', credentials=self.creds)
                         self.sheets_service = build('sheets', 'v4', credentials=self.creds)
-                        print("✅ Token đã được gia hạn thành công!")
+                        sheets_log.info("✅ Token đã được gia hạn thành công!")
                         return True
                     except Exception as refresh_error:
                         error_str = str(refresh_error)
                         if 'invalid_grant' in error_str.lower():
-                            print("❌ Lỗi invalid_grant: Refresh token không hợp lệ")
-                            print("💡 Cần tạo token mới bằng cách chạy: python refresh_token.py")
+                            sheets_log.error("❌ Lỗi invalid_grant: Refresh token không hợp lệ")
+                            sheets_log.debug("💡 Cần tạo token mới bằng cách chạy: python refresh_token.py")
                             # Xóa token cũ để tránh lỗi lặp lại
                             try:
                                 if os.path.exists(self.token_file):
                                     backup_name = f"token_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
                                     shutil.copy2(self.token_file, backup_name)
                                     os.remove(self.token_file)
-                                    print(f"💾 Đã backup và xóa token cũ: {backup_name}")
+                                    sheets_log.debug("💾 Đã backup và xóa token cũ: %s", backup_name)
                             except Exception:
                                 pass
                         else:
-                            print(f"❌ Lỗi khi refresh token: {refresh_error}")
+                            sheets_log.error("❌ Lỗi khi refresh token: %s", refresh_error)
                         return False
                 else:
-                    print("❌ Không có refresh_token, cần xác thực lại")
+                    sheets_log.error("❌ Không có refresh_token, cần xác thực lại")
                     return False
             
             # Kiểm tra xem services có hoạt động không
             if not self.drive_service or not self.sheets_service:
-                print("🔄 Khởi tạo lại services...")
+                sheets_log.debug("🔄 Khởi tạo lại services...")
                 self.drive_service = build('drive', 'v3', credentials=self.creds)
                 self.sheets_service = build('sheets', 'v4', credentials=self.creds)
-                print("✅ Services đã được khởi tạo lại!")
+                sheets_log.info("✅ Services đã được khởi tạo lại!")
             
             return True
         except Exception as e:
-            print(f"❌ Lỗi khi đảm bảo token hợp lệ: {e}")
+            sheets_log.error("❌ Lỗi khi đảm bảo token hợp lệ: %s", e)
             return False
     
     def should_refresh_token(self):
@@ -2506,12 +2301,12 @@ class GoogleDriveAPI:
             
             # Kiểm tra xem token có hết hạn không
             if self.creds.expired:
-                print("⚠️ Token đã hết hạn!")
+                sheets_log.warning("⚠️ Token đã hết hạn!")
                 return True  # Token đã hết hạn, cần gia hạn
             
             # Kiểm tra file lần gia hạn cuối
             if not os.path.exists(self.last_refresh_file):
-                print("⚠️ Chưa có file lưu thời gian gia hạn, cần gia hạn")
+                sheets_log.warning("⚠️ Chưa có file lưu thời gian gia hạn, cần gia hạn")
                 return True  # Chưa có file, cần gia hạn
             
             # Đọc thời gian gia hạn cuối
@@ -2525,28 +2320,28 @@ class GoogleDriveAPI:
             # Nếu đã qua 45 phút thì cần gia hạn (Google tokens thường hết hạn sau 1 giờ)
             # Gia hạn sớm 15 phút để đảm bảo không bao giờ hết hạn
             if time_diff >= 45 * 60:  # 45 phút
-                print(f"⚠️ Token sắp hết hạn (đã {time_diff/60:.1f} phút), cần gia hạn")
+                sheets_log.warning("⚠️ Token sắp hết hạn (đã %.1f phút), cần gia hạn", time_diff / 60)
                 return True
             
             # Cảnh báo khi còn 10 phút nữa sẽ gia hạn
             if time_diff >= 35 * 60:  # 35 phút
-                print(f"ℹ️ Token sẽ được gia hạn trong {45 - time_diff/60:.1f} phút nữa")
+                sheets_log.debug("ℹ️ Token sẽ được gia hạn trong %.1f phút nữa", 45 - time_diff / 60)
             
             return False
         except Exception as e:
-            print(f"❌ Lỗi khi kiểm tra thời gian gia hạn: {e}")
+            sheets_log.error("❌ Lỗi khi kiểm tra thời gian gia hạn: %s", e)
             return True  # Nếu có lỗi thì gia hạn để an toàn
     
     def refresh_token(self):
         """Gia hạn token"""
         try:
             if not self.creds:
-                print("Không có credentials để gia hạn")
+                sheets_log.debug("Không có credentials để gia hạn")
                 return False
             
             # Luôn thử gia hạn token nếu có refresh_token
             if self.creds.refresh_token:
-                print("Đang gia hạn token...")
+                sheets_log.debug("Đang gia hạn token...")
                 self.creds.refresh(GoogleRequest())
 
                 # Lưu token mới dạng JSON (thống nhất với ensure_valid_token)
@@ -2557,13 +2352,13 @@ class GoogleDriveAPI:
                 self.drive_service = build('drive', 'v3', credentials=self.creds)
                 self.sheets_service = build('sheets', 'v4', credentials=self.creds)
                 
-                print("✅ Token đã được gia hạn thành công!")
+                sheets_log.info("✅ Token đã được gia hạn thành công!")
                 return True
             else:
-                print("Không có refresh_token, cần xác thực lại")
+                sheets_log.debug("Không có refresh_token, cần xác thực lại")
                 return False
         except Exception as e:
-            print(f"Lỗi khi gia hạn token: {e}")
+            sheets_log.error("Lỗi khi gia hạn token: %s", e)
             return False
     
     def save_last_refresh_time(self):
@@ -2572,7 +2367,7 @@ class GoogleDriveAPI:
             with open(self.last_refresh_file, 'w') as f:
                 f.write(datetime.now().isoformat())
         except Exception as e:
-            print(f"Lỗi khi lưu thời gian gia hạn: {e}")
+            sheets_log.error("Lỗi khi lưu thời gian gia hạn: %s", e)
     
     def update_sheet_value(self, spreadsheet_id, sheet_name, row, column, new_value):
         """
@@ -2589,23 +2384,22 @@ class GoogleDriveAPI:
             bool: True nếu thành công, False nếu thất bại
         """
         import time
-        from datetime import datetime as dt
         
         # Validation đầu vào
         if not spreadsheet_id or not isinstance(spreadsheet_id, str) or not spreadsheet_id.strip():
-            print(f"❌ [UPDATE_SHEET_VALUE] Spreadsheet ID không hợp lệ: {spreadsheet_id}")
+            sheets_log.error("❌ [UPDATE_SHEET_VALUE] Spreadsheet ID không hợp lệ: %s", spreadsheet_id)
             return False
         
         if not sheet_name or not isinstance(sheet_name, str) or not sheet_name.strip():
-            print(f"❌ [UPDATE_SHEET_VALUE] Sheet name không hợp lệ: {sheet_name}")
+            sheets_log.error("❌ [UPDATE_SHEET_VALUE] Sheet name không hợp lệ: %s", sheet_name)
             return False
         
         if not isinstance(row, int) or row < 1:
-            print(f"❌ [UPDATE_SHEET_VALUE] Row không hợp lệ: {row}")
+            sheets_log.error("❌ [UPDATE_SHEET_VALUE] Row không hợp lệ: %s", row)
             return False
         
         if not column or not isinstance(column, str) or not column.strip():
-            print(f"❌ [UPDATE_SHEET_VALUE] Column không hợp lệ: {column}")
+            sheets_log.error("❌ [UPDATE_SHEET_VALUE] Column không hợp lệ: %s", column)
             return False
         
         # Sanitize giá trị
@@ -2620,27 +2414,26 @@ class GoogleDriveAPI:
         
         for attempt in range(max_retries):
             try:
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 if attempt > 0:
-                    print(f"🔄 [UPDATE_SHEET_VALUE] Lần thử {attempt + 1}/{max_retries} - {timestamp}")
+                    sheets_log.debug("🔄 [UPDATE_SHEET_VALUE] Lần thử %s/%s", attempt + 1, max_retries)
                 
                 # Đảm bảo token luôn hợp lệ trước khi sử dụng API
                 if not self.ensure_valid_token():
-                    print("❌ [UPDATE_SHEET_VALUE] Không thể đảm bảo token hợp lệ")
+                    sheets_log.error("❌ [UPDATE_SHEET_VALUE] Không thể đảm bảo token hợp lệ")
                     return False
                 
                 if not self.sheets_service:
-                    print("❌ [UPDATE_SHEET_VALUE] Sheets service không khả dụng")
+                    sheets_log.error("❌ [UPDATE_SHEET_VALUE] Sheets service không khả dụng")
                     return False
                 
                 # Tạo range từ các tham số
                 range_name = f"{sheet_name}!{column}{row}"
                 
-                print(f"\n🔧 [UPDATE_SHEET_VALUE] CẬP NHẬT GIÁ TRỊ TRONG SHEET:")
-                print(f"   Sheet: {sheet_name}")
-                print(f"   Ô: {column}{row}")
-                print(f"   Giá trị mới: {new_value}")
-                print(f"   Range: {range_name}")
+                sheets_log.debug("🔧 [UPDATE_SHEET_VALUE] CẬP NHẬT GIÁ TRỊ TRONG SHEET:")
+                sheets_log.debug("   Sheet: %s", sheet_name)
+                sheets_log.debug("   Ô: %s%s", column, row)
+                sheets_log.debug("   Giá trị mới: %s", new_value)
+                sheets_log.debug("   Range: %s", range_name)
                 
                 # Cập nhật giá trị
                 body = {
@@ -2655,51 +2448,49 @@ class GoogleDriveAPI:
                 ).execute()
                 
                 updated_cells = result.get('updatedCells', 0)
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                print(f"✅ [UPDATE_SHEET_VALUE_SUCCESS] {timestamp} - Cập nhật thành công! Số ô đã cập nhật: {updated_cells}")
+                sheets_log.info("✅ [UPDATE_SHEET_VALUE_SUCCESS] Cập nhật thành công! Số ô đã cập nhật: %s", updated_cells)
                 
                 # Căn giữa cell sau khi cập nhật (không bắt buộc, nếu lỗi vẫn coi là thành công)
                 try:
                     self.center_align_cells(spreadsheet_id, sheet_name, [range_name])
                 except Exception as e:
-                    print(f"⚠️ [UPDATE_SHEET_VALUE] Không thể căn giữa cell (không ảnh hưởng kết quả): {e}")
+                    sheets_log.warning("⚠️ [UPDATE_SHEET_VALUE] Không thể căn giữa cell (không ảnh hưởng kết quả): %s", e)
                 
                 return True
                 
             except Exception as e:
                 error_str = str(e)
                 error_type = type(e).__name__
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 
                 # Phân loại lỗi
                 is_retryable = False
                 if '429' in error_str or 'quota' in error_str.lower() or 'rate limit' in error_str.lower():
                     is_retryable = True
-                    print(f"⚠️ [UPDATE_SHEET_VALUE] {timestamp} - Rate limit/quota error (có thể retry): {error_str}")
+                    sheets_log.warning("⚠️ [UPDATE_SHEET_VALUE] Rate limit/quota error (có thể retry): %s", error_str)
                 elif '503' in error_str or '500' in error_str or 'timeout' in error_str.lower():
                     is_retryable = True
-                    print(f"⚠️ [UPDATE_SHEET_VALUE] {timestamp} - Server error (có thể retry): {error_str}")
+                    sheets_log.warning("⚠️ [UPDATE_SHEET_VALUE] Server error (có thể retry): %s", error_str)
                 elif 'PERMISSION_DENIED' in error_str or 'permission' in error_str.lower():
-                    print(f"❌ [UPDATE_SHEET_VALUE] {timestamp} - Lỗi quyền truy cập: {error_str}")
+                    sheets_log.error("❌ [UPDATE_SHEET_VALUE] Lỗi quyền truy cập: %s", error_str)
                     return False  # Không retry lỗi quyền
                 elif 'NOT_FOUND' in error_str or 'not found' in error_str.lower():
-                    print(f"❌ [UPDATE_SHEET_VALUE] {timestamp} - Spreadsheet hoặc sheet không tồn tại: {error_str}")
+                    sheets_log.error("❌ [UPDATE_SHEET_VALUE] Spreadsheet hoặc sheet không tồn tại: %s", error_str)
                     return False  # Không retry lỗi không tìm thấy
                 else:
-                    print(f"❌ [UPDATE_SHEET_VALUE] {timestamp} - Lỗi không xác định: {error_type} - {error_str}")
+                    sheets_log.error("❌ [UPDATE_SHEET_VALUE] Lỗi không xác định: %s - %s", error_type, error_str)
                 
                 # Retry nếu có thể
                 if is_retryable and attempt < max_retries - 1:
                     wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"⏳ [UPDATE_SHEET_VALUE] Đợi {wait_time} giây trước khi retry...")
+                    sheets_log.debug("⏳ [UPDATE_SHEET_VALUE] Đợi %s giây trước khi retry...", wait_time)
                     time.sleep(wait_time)
                 else:
                     # Không thể retry hoặc đã hết số lần thử
                     import traceback
-                    print(f"❌ [UPDATE_SHEET_VALUE_FAILED] {timestamp} - Cập nhật thất bại sau {attempt + 1} lần thử")
-                    print(f"   Error Type: {error_type}")
-                    print(f"   Error Message: {error_str}")
-                    print(f"   Traceback:\n{traceback.format_exc()}")
+                    sheets_log.error("❌ [UPDATE_SHEET_VALUE_FAILED] Cập nhật thất bại sau %s lần thử", attempt + 1)
+                    sheets_log.error("   Error Type: %s", error_type)
+                    sheets_log.error("   Error Message: %s", error_str)
+                    sheets_log.error("   Traceback:\n%s", traceback.format_exc())
                     return False
         
         return False
@@ -2715,37 +2506,36 @@ class GoogleDriveAPI:
             bool: True nếu thành công, False nếu thất bại
         """
         import time
-        from datetime import datetime as dt
         
         # Validation đầu vào
         if not spreadsheet_id or not isinstance(spreadsheet_id, str) or not spreadsheet_id.strip():
-            print(f"❌ [BATCH_UPDATE] Spreadsheet ID không hợp lệ: {spreadsheet_id}")
+            sheets_log.error("❌ [BATCH_UPDATE] Spreadsheet ID không hợp lệ: %s", spreadsheet_id)
             return False
         
         if not data_ranges or not isinstance(data_ranges, list) or len(data_ranges) == 0:
-            print(f"❌ [BATCH_UPDATE] Data ranges không hợp lệ hoặc rỗng")
+            sheets_log.error("❌ [BATCH_UPDATE] Data ranges không hợp lệ hoặc rỗng")
             return False
         
         # Validate và sanitize từng range
         sanitized_ranges = []
         for idx, range_data in enumerate(data_ranges):
             if not isinstance(range_data, dict):
-                print(f"⚠️ [BATCH_UPDATE] Range {idx} không phải dict, bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE] Range %s không phải dict, bỏ qua", idx)
                 continue
             
             if 'range' not in range_data or 'values' not in range_data:
-                print(f"⚠️ [BATCH_UPDATE] Range {idx} thiếu 'range' hoặc 'values', bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE] Range %s thiếu 'range' hoặc 'values', bỏ qua", idx)
                 continue
             
             range_name = str(range_data['range']).strip()
             values = range_data['values']
             
             if not range_name:
-                print(f"⚠️ [BATCH_UPDATE] Range {idx} có tên rỗng, bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE] Range %s có tên rỗng, bỏ qua", idx)
                 continue
             
             if not isinstance(values, list) or len(values) == 0:
-                print(f"⚠️ [BATCH_UPDATE] Range {idx} có values rỗng, bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE] Range %s có values rỗng, bỏ qua", idx)
                 continue
             
             # Sanitize values - đảm bảo tất cả là string và không có None
@@ -2769,7 +2559,7 @@ class GoogleDriveAPI:
             })
         
         if len(sanitized_ranges) == 0:
-            print(f"❌ [BATCH_UPDATE] Không có range hợp lệ nào sau khi sanitize")
+            sheets_log.error("❌ [BATCH_UPDATE] Không có range hợp lệ nào sau khi sanitize")
             return False
         
         # Retry logic với exponential backoff
@@ -2778,16 +2568,15 @@ class GoogleDriveAPI:
         
         for attempt in range(max_retries):
             try:
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 if attempt > 0:
-                    print(f"🔄 [BATCH_UPDATE] Lần thử {attempt + 1}/{max_retries} - {timestamp}")
+                    sheets_log.debug("🔄 [BATCH_UPDATE] Lần thử %s/%s", attempt + 1, max_retries)
                 
                 if not self.ensure_valid_token():
-                    print("❌ [BATCH_UPDATE] Không thể đảm bảo token hợp lệ")
+                    sheets_log.error("❌ [BATCH_UPDATE] Không thể đảm bảo token hợp lệ")
                     return False
                 
                 if not self.sheets_service:
-                    print("❌ [BATCH_UPDATE] Sheets service không khả dụng")
+                    sheets_log.error("❌ [BATCH_UPDATE] Sheets service không khả dụng")
                     return False
                 
                 body = {
@@ -2801,44 +2590,42 @@ class GoogleDriveAPI:
                 ).execute()
                 
                 updated = result.get('totalUpdatedCells', 0)
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                print(f"✅ [BATCH_UPDATE_SUCCESS] {timestamp} - Batch update thành công, số ô cập nhật: {updated}")
+                sheets_log.info("✅ [BATCH_UPDATE_SUCCESS] Batch update thành công, số ô cập nhật: %s", updated)
                 return True
                 
             except Exception as e:
                 error_str = str(e)
                 error_type = type(e).__name__
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 
                 # Phân loại lỗi
                 is_retryable = False
                 if '429' in error_str or 'quota' in error_str.lower() or 'rate limit' in error_str.lower():
                     is_retryable = True
-                    print(f"⚠️ [BATCH_UPDATE] {timestamp} - Rate limit/quota error (có thể retry): {error_str}")
+                    sheets_log.warning("⚠️ [BATCH_UPDATE] Rate limit/quota error (có thể retry): %s", error_str)
                 elif '503' in error_str or '500' in error_str or 'timeout' in error_str.lower():
                     is_retryable = True
-                    print(f"⚠️ [BATCH_UPDATE] {timestamp} - Server error (có thể retry): {error_str}")
+                    sheets_log.warning("⚠️ [BATCH_UPDATE] Server error (có thể retry): %s", error_str)
                 elif 'PERMISSION_DENIED' in error_str or 'permission' in error_str.lower():
-                    print(f"❌ [BATCH_UPDATE] {timestamp} - Lỗi quyền truy cập: {error_str}")
+                    sheets_log.error("❌ [BATCH_UPDATE] Lỗi quyền truy cập: %s", error_str)
                     return False  # Không retry lỗi quyền
                 elif 'NOT_FOUND' in error_str or 'not found' in error_str.lower():
-                    print(f"❌ [BATCH_UPDATE] {timestamp} - Spreadsheet hoặc sheet không tồn tại: {error_str}")
+                    sheets_log.error("❌ [BATCH_UPDATE] Spreadsheet hoặc sheet không tồn tại: %s", error_str)
                     return False  # Không retry lỗi không tìm thấy
                 else:
-                    print(f"❌ [BATCH_UPDATE] {timestamp} - Lỗi không xác định: {error_type} - {error_str}")
+                    sheets_log.error("❌ [BATCH_UPDATE] Lỗi không xác định: %s - %s", error_type, error_str)
                 
                 # Retry nếu có thể
                 if is_retryable and attempt < max_retries - 1:
                     wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"⏳ [BATCH_UPDATE] Đợi {wait_time} giây trước khi retry...")
+                    sheets_log.debug("⏳ [BATCH_UPDATE] Đợi %s giây trước khi retry...", wait_time)
                     time.sleep(wait_time)
                 else:
                     # Không thể retry hoặc đã hết số lần thử
                     import traceback
-                    print(f"❌ [BATCH_UPDATE_FAILED] {timestamp} - Batch update thất bại sau {attempt + 1} lần thử")
-                    print(f"   Error Type: {error_type}")
-                    print(f"   Error Message: {error_str}")
-                    print(f"   Traceback:\n{traceback.format_exc()}")
+                    sheets_log.error("❌ [BATCH_UPDATE_FAILED] Batch update thất bại sau %s lần thử", attempt + 1)
+                    sheets_log.error("   Error Type: %s", error_type)
+                    sheets_log.error("   Error Message: %s", error_str)
+                    sheets_log.error("   Traceback:\n%s", traceback.format_exc())
                     return False
         
         return False
@@ -2855,27 +2642,27 @@ class GoogleDriveAPI:
             bool: True nếu thành công, False nếu thất bại
         """
         import time
-        from datetime import datetime as dt
         
         # Validation đầu vào
-        print(f"🔍 [DEBUG] batch_update_values_with_formatting called with sheet_name={sheet_name}, type={type(sheet_name)}")
+        sheets_log.debug("🔍 [DEBUG] batch_update_values_with_formatting called with sheet_name=%s, type=%s", sheet_name, type(sheet_name))
         if not spreadsheet_id or not isinstance(spreadsheet_id, str) or not spreadsheet_id.strip():
-            print(f"❌ [BATCH_UPDATE_FORMAT] Spreadsheet ID không hợp lệ: {spreadsheet_id}")
+            sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Spreadsheet ID không hợp lệ: %s", spreadsheet_id)
             return False
 
         if not sheet_name or not isinstance(sheet_name, str) or not sheet_name.strip():
-            print(f"❌ [BATCH_UPDATE_FORMAT] Sheet name không hợp lệ: {sheet_name} (type={type(sheet_name).__name__})")
+            sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Sheet name không hợp lệ: %s (type=%s)", sheet_name, type(sheet_name).__name__)
             return False
         
         if not data_ranges or not isinstance(data_ranges, list) or len(data_ranges) == 0:
-            print(f"❌ [BATCH_UPDATE_FORMAT] Data ranges không hợp lệ hoặc rỗng")
+            sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Data ranges không hợp lệ hoặc rỗng")
             return False
         
-        # Lấy sheet ID
+        # Lấy sheet ID (range dạng 'Sheet!A1' của sheet khác -> lấy ID của sheet đó)
         sheet_id = self._get_sheet_id(spreadsheet_id, sheet_name)
         if sheet_id is None:
-            print(f"❌ [BATCH_UPDATE_FORMAT] Không thể lấy sheet ID cho sheet '{sheet_name}'")
+            sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Không thể lấy sheet ID cho sheet '%s'", sheet_name)
             return False
+        sheet_ids = {sheet_name: sheet_id}
         
         # Validate và sanitize từng range, đồng thời tạo formatting requests
         sanitized_ranges = []
@@ -2883,22 +2670,22 @@ class GoogleDriveAPI:
         
         for idx, range_data in enumerate(data_ranges):
             if not isinstance(range_data, dict):
-                print(f"⚠️ [BATCH_UPDATE_FORMAT] Range {idx} không phải dict, bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Range %s không phải dict, bỏ qua", idx)
                 continue
             
             if 'range' not in range_data or 'values' not in range_data:
-                print(f"⚠️ [BATCH_UPDATE_FORMAT] Range {idx} thiếu 'range' hoặc 'values', bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Range %s thiếu 'range' hoặc 'values', bỏ qua", idx)
                 continue
             
             range_name = str(range_data['range']).strip()
             values = range_data['values']
             
             if not range_name:
-                print(f"⚠️ [BATCH_UPDATE_FORMAT] Range {idx} có tên rỗng, bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Range %s có tên rỗng, bỏ qua", idx)
                 continue
             
             if not isinstance(values, list) or len(values) == 0:
-                print(f"⚠️ [BATCH_UPDATE_FORMAT] Range {idx} có values rỗng, bỏ qua")
+                sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Range %s có values rỗng, bỏ qua", idx)
                 continue
             
             # Sanitize values
@@ -2924,15 +2711,20 @@ class GoogleDriveAPI:
             # Parse A1 notation để lấy GridRange
             try:
                 # Tách phần range (bỏ phần sheet name)
+                range_sheet_id = sheet_id
                 if '!' in range_name:
-                    range_part = range_name.split('!')[1]
+                    range_sheet, range_part = range_name.rsplit('!', 1)
+                    range_sheet = range_sheet.strip("'")
+                    if range_sheet not in sheet_ids:
+                        sheet_ids[range_sheet] = self._get_sheet_id(spreadsheet_id, range_sheet)
+                    range_sheet_id = sheet_ids[range_sheet]
                 else:
                     range_part = range_name
                 
                 # Parse cột và dòng (ví dụ: G5 -> column=6, row=4 (0-based))
                 import re
                 match = re.match(r'([A-Z]+)(\d+)', range_part)
-                if match:
+                if match and range_sheet_id is not None:
                     col_str = match.group(1)
                     row_str = match.group(2)
                     
@@ -2957,7 +2749,7 @@ class GoogleDriveAPI:
                     format_requests.append({
                         'repeatCell': {
                             'range': {
-                                'sheetId': sheet_id,
+                                'sheetId': range_sheet_id,
                                 'startRowIndex': start_row_index,
                                 'endRowIndex': start_row_index + num_rows,
                                 'startColumnIndex': col_index,
@@ -2977,10 +2769,10 @@ class GoogleDriveAPI:
                         }
                     })
             except Exception as e:
-                print(f"⚠️ [BATCH_UPDATE_FORMAT] Không thể parse range {range_name} để format: {e}")
+                sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Không thể parse range %s để format: %s", range_name, e)
         
         if len(sanitized_ranges) == 0:
-            print(f"❌ [BATCH_UPDATE_FORMAT] Không có range hợp lệ nào sau khi sanitize")
+            sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Không có range hợp lệ nào sau khi sanitize")
             return False
 
         # Retry logic với exponential backoff - TĂNG SỐ LẦN VÀ DELAY
@@ -2990,16 +2782,15 @@ class GoogleDriveAPI:
 
         for attempt in range(max_retries):
             try:
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 if attempt > 0:
-                    print(f"🔄 [BATCH_UPDATE_FORMAT] Lần thử {attempt + 1}/{max_retries} - {timestamp}")
+                    sheets_log.debug("🔄 [BATCH_UPDATE_FORMAT] Lần thử %s/%s", attempt + 1, max_retries)
 
                 if not self.ensure_valid_token():
-                    print("❌ [BATCH_UPDATE_FORMAT] Không thể đảm bảo token hợp lệ")
+                    sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Không thể đảm bảo token hợp lệ")
                     return False
 
                 if not self.sheets_service:
-                    print("❌ [BATCH_UPDATE_FORMAT] Sheets service không khả dụng")
+                    sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Sheets service không khả dụng")
                     return False
 
                 # Kiểm tra rate limit trước khi gọi API
@@ -3017,8 +2808,7 @@ class GoogleDriveAPI:
                 ).execute()
 
                 updated = values_result.get('totalUpdatedCells', 0)
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                print(f"✅ [BATCH_UPDATE_FORMAT] {timestamp} - Cập nhật values thành công, số ô: {updated}")
+                sheets_log.info("✅ [BATCH_UPDATE_FORMAT] Cập nhật values thành công, số ô: %s", updated)
 
                 # Kiểm tra rate limit trước khi format
                 self._check_and_wait_rate_limit()
@@ -3034,15 +2824,13 @@ class GoogleDriveAPI:
                         body=format_body
                     ).execute()
 
-                    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                    print(f"✅ [BATCH_UPDATE_FORMAT] {timestamp} - Áp dụng formatting thành công cho {len(format_requests)} ranges")
+                    sheets_log.info("✅ [BATCH_UPDATE_FORMAT] Áp dụng formatting thành công cho %s ranges", len(format_requests))
 
                 return True
 
             except Exception as e:
                 error_str = str(e)
                 error_type = type(e).__name__
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
                 # Phân loại lỗi
                 is_retryable = False
@@ -3050,34 +2838,35 @@ class GoogleDriveAPI:
                 if '429' in error_str or 'quota' in error_str.lower() or 'rate limit' in error_str.lower():
                     is_retryable = True
                     is_rate_limit = True
-                    print(f"⚠️ [BATCH_UPDATE_FORMAT] {timestamp} - Rate limit/quota error (sẽ đợi lâu hơn): {error_str}")
+                    sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Rate limit/quota error (sẽ đợi lâu hơn): %s", error_str)
                 elif '503' in error_str or '500' in error_str or 'timeout' in error_str.lower():
                     is_retryable = True
-                    print(f"⚠️ [BATCH_UPDATE_FORMAT] {timestamp} - Server error (có thể retry): {error_str}")
+                    sheets_log.warning("⚠️ [BATCH_UPDATE_FORMAT] Server error (có thể retry): %s", error_str)
                 elif 'PERMISSION_DENIED' in error_str or 'permission' in error_str.lower():
-                    print(f"❌ [BATCH_UPDATE_FORMAT] {timestamp} - Lỗi quyền truy cập: {error_str}")
+                    sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Lỗi quyền truy cập: %s", error_str)
                     return False
                 elif 'NOT_FOUND' in error_str or 'not found' in error_str.lower():
-                    print(f"❌ [BATCH_UPDATE_FORMAT] {timestamp} - Spreadsheet hoặc sheet không tồn tại: {error_str}")
+                    sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Spreadsheet hoặc sheet không tồn tại: %s", error_str)
                     return False
                 else:
-                    print(f"❌ [BATCH_UPDATE_FORMAT] {timestamp} - Lỗi không xác định: {error_type} - {error_str}")
+                    sheets_log.error("❌ [BATCH_UPDATE_FORMAT] Lỗi không xác định: %s - %s", error_type, error_str)
 
                 # Retry nếu có thể
                 if is_retryable and attempt < max_retries - 1:
                     # Đợi lâu hơn nếu là rate limit error
                     if is_rate_limit:
                         wait_time = rate_limit_delay + (attempt * 10)  # 30, 40, 50, 60 giây
+                        google_quota.pause(wait_time)
                     else:
                         wait_time = base_retry_delay * (2 ** attempt)  # 2, 4, 8, 16 giây
-                    print(f"⏳ [BATCH_UPDATE_FORMAT] Đợi {wait_time} giây trước khi retry...")
+                    sheets_log.debug("⏳ [BATCH_UPDATE_FORMAT] Đợi %s giây trước khi retry...", wait_time)
                     time.sleep(wait_time)
                 else:
                     import traceback
-                    print(f"❌ [BATCH_UPDATE_FORMAT_FAILED] {timestamp} - Batch update thất bại sau {attempt + 1} lần thử")
-                    print(f"   Error Type: {error_type}")
-                    print(f"   Error Message: {error_str}")
-                    print(f"   Traceback:\n{traceback.format_exc()}")
+                    sheets_log.error("❌ [BATCH_UPDATE_FORMAT_FAILED] Batch update thất bại sau %s lần thử", attempt + 1)
+                    sheets_log.error("   Error Type: %s", error_type)
+                    sheets_log.error("   Error Message: %s", error_str)
+                    sheets_log.error("   Traceback:\n%s", traceback.format_exc())
                     return False
 
         return False
@@ -3093,15 +2882,14 @@ class GoogleDriveAPI:
         Returns:
             bool: True nếu thành công, False nếu thất bại
         """
-        from datetime import datetime as dt
         
         # Validation đầu vào
         if not spreadsheet_id or not isinstance(spreadsheet_id, str) or not spreadsheet_id.strip():
-            print(f"❌ [CENTER_ALIGN] Spreadsheet ID không hợp lệ: {spreadsheet_id}")
+            sheets_log.error("❌ [CENTER_ALIGN] Spreadsheet ID không hợp lệ: %s", spreadsheet_id)
             return False
         
         if not sheet_name or not isinstance(sheet_name, str) or not sheet_name.strip():
-            print(f"❌ [CENTER_ALIGN] Sheet name không hợp lệ: {sheet_name}")
+            sheets_log.error("❌ [CENTER_ALIGN] Sheet name không hợp lệ: %s", sheet_name)
             return False
         
         if not ranges or not isinstance(ranges, list) or len(ranges) == 0:
@@ -3109,17 +2897,17 @@ class GoogleDriveAPI:
         
         try:
             if not self.ensure_valid_token():
-                print("❌ [CENTER_ALIGN] Không thể đảm bảo token hợp lệ")
+                sheets_log.error("❌ [CENTER_ALIGN] Không thể đảm bảo token hợp lệ")
                 return False
             
             if not self.sheets_service:
-                print("❌ [CENTER_ALIGN] Sheets service không khả dụng")
+                sheets_log.error("❌ [CENTER_ALIGN] Sheets service không khả dụng")
                 return False
             
             # Lấy sheet ID
             sheet_id = self._get_sheet_id(spreadsheet_id, sheet_name)
             if sheet_id is None:
-                print("⚠️ [CENTER_ALIGN] Không thể lấy sheet ID")
+                sheets_log.warning("⚠️ [CENTER_ALIGN] Không thể lấy sheet ID")
                 return False
             
             # Chuyển đổi A1 notation sang GridRange
@@ -3158,7 +2946,7 @@ class GoogleDriveAPI:
                         'endColumnIndex': col_index + 1
                     }
                 except Exception as e:
-                    print(f"⚠️ Lỗi parse range {a1_range}: {e}")
+                    sheets_log.warning("⚠️ Lỗi parse range %s: %s", a1_range, e)
                     return None
             
             # Tạo requests để căn giữa các cells
@@ -3184,7 +2972,7 @@ class GoogleDriveAPI:
                     })
             
             if not requests:
-                print("⚠️ [CENTER_ALIGN] Không có requests hợp lệ để căn giữa")
+                sheets_log.warning("⚠️ [CENTER_ALIGN] Không có requests hợp lệ để căn giữa")
                 return False
             
             body = {
@@ -3196,84 +2984,77 @@ class GoogleDriveAPI:
                 body=body
             ).execute()
             
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            print(f"✅ [CENTER_ALIGN_SUCCESS] {timestamp} - Căn giữa thành công cho {len(requests)} cells")
+            sheets_log.info("✅ [CENTER_ALIGN_SUCCESS] Căn giữa thành công cho %s cells", len(requests))
             return True
         except Exception as e:
             error_str = str(e)
             error_type = type(e).__name__
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
             
             # Căn giữa không phải là chức năng bắt buộc, nếu lỗi chỉ log warning
             if 'PERMISSION_DENIED' in error_str or 'NOT_FOUND' in error_str:
-                print(f"⚠️ [CENTER_ALIGN] {timestamp} - Không thể căn giữa (lỗi quyền/tìm thấy): {error_str}")
+                sheets_log.warning("⚠️ [CENTER_ALIGN] Không thể căn giữa (lỗi quyền/tìm thấy): %s", error_str)
             else:
-                print(f"⚠️ [CENTER_ALIGN] {timestamp} - Không thể căn giữa cells: {error_type} - {error_str}")
+                sheets_log.warning("⚠️ [CENTER_ALIGN] Không thể căn giữa cells: %s - %s", error_type, error_str)
                 import traceback
-                print(traceback.format_exc())
+                sheets_log.error("%s", traceback.format_exc())
             
             # Vẫn return False nhưng không crash app
             return False
 
     def _check_and_wait_rate_limit(self):
-        """Kiểm tra và đợi nếu sắp vượt rate limit."""
-        import time
-        current_time = time.time()
+        """Kiểm tra và đợi nếu sắp vượt rate limit (quota chung của cả tiến trình)."""
+        waited = google_quota.acquire()
+        if waited >= 1:
+            sheets_log.debug("⏳ [RATE_LIMIT] Đã đợi %.1fs để tránh vượt quota Google API", waited)
+
+    def fork(self):
+        """Instance dùng chung credentials nhưng có HTTP client riêng cho 1 thread
+        (service của googleapiclient / httplib2 không thread-safe)."""
+        clone = GoogleDriveAPI.__new__(GoogleDriveAPI)
+        clone.__dict__.update(self.__dict__)
+        if self.creds is not None and self.sheets_service is not None:
+            clone.drive_service = build('drive', 'v3', credentials=self.creds)
+            clone.sheets_service = build('sheets', 'v4', credentials=self.creds)
+        return clone
+
+    def get_sheet_map(self, spreadsheet_id, force_refresh=False):
+        """Lấy {tên sheet: sheetId} của spreadsheet - dùng cache chung, chỉ gọi API khi cache miss.
 
-        # Xóa các timestamps quá 60 giây
-        self._api_call_timestamps = [
-            t for t in self._api_call_timestamps
-            if current_time - t < self._rate_limit_window
-        ]
+        Returns:
+            dict hoặc None nếu không lấy được
+        """
+        if not force_refresh:
+            cached = drive_metadata_cache.get_sheet_map(spreadsheet_id)
+            if cached is not None:
+                return cached
 
-        # Nếu sắp vượt ngưỡng, đợi
-        if len(self._api_call_timestamps) >= self._rate_limit_max_calls:
-            oldest_call = min(self._api_call_timestamps)
-            wait_time = self._rate_limit_window - (current_time - oldest_call) + 1
-            if wait_time > 0:
-                print(f"⏳ [RATE_LIMIT] Đợi {wait_time:.1f}s để tránh vượt quota (đã có {len(self._api_call_timestamps)} calls trong 60s)...")
-                time.sleep(wait_time)
-                # Xóa lại sau khi đợi
-                current_time = time.time()
-                self._api_call_timestamps = [
-                    t for t in self._api_call_timestamps
-                    if current_time - t < self._rate_limit_window
-                ]
+        if not self.ensure_valid_token() or not self.sheets_service:
+            return None
+
+        # Kiểm tra rate limit trước khi gọi API
+        self._check_and_wait_rate_limit()
 
-        # Ghi nhận call mới
-        self._api_call_timestamps.append(time.time())
+        spreadsheet = self.sheets_service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties(sheetId,title)'
+        ).execute()
+
+        sheet_map = {
+            sheet['properties']['title']: sheet['properties']['sheetId']
+            for sheet in spreadsheet.get('sheets', [])
+        }
+        drive_metadata_cache.set_sheet_map(spreadsheet_id, sheet_map)
+        return sheet_map
 
     def _get_sheet_id(self, spreadsheet_id, sheet_name):
         """Lấy sheet ID từ tên sheet - CÓ CACHE để giảm API calls."""
-        # Kiểm tra cache trước
-        cache_key = f"{spreadsheet_id}:{sheet_name}"
-        if cache_key in self._sheet_id_cache:
-            return self._sheet_id_cache[cache_key]
-
         try:
-            if not self.ensure_valid_token():
+            sheet_map = self.get_sheet_map(spreadsheet_id)
+            if sheet_map is None:
                 return None
-
-            # Kiểm tra rate limit trước khi gọi API
-            self._check_and_wait_rate_limit()
-
-            spreadsheet = self.sheets_service.spreadsheets().get(
-                spreadsheetId=spreadsheet_id
-            ).execute()
-
-            sheets = spreadsheet.get('sheets', [])
-
-            # Cache tất cả sheet IDs trong spreadsheet này
-            for sheet in sheets:
-                title = sheet['properties']['title']
-                sheet_id = sheet['properties']['sheetId']
-                key = f"{spreadsheet_id}:{title}"
-                self._sheet_id_cache[key] = sheet_id
-
-            # Trả về sheet ID được yêu cầu
-            return self._sheet_id_cache.get(cache_key)
+            return sheet_map.get(sheet_name)
         except Exception as e:
-            print(f"⚠️ Không thể lấy sheet ID: {e}")
+            sheets_log.warning("⚠️ Không thể lấy sheet ID: %s", e)
             return None
 
     def _column_index_to_letter(self, index_zero_based):
@@ -3310,7 +3091,7 @@ class GoogleDriveAPI:
                     continue
             
             if dt is None:
-                print(f"⚠️ Không thể parse ngày: {date_str_iso}")
+                sheets_log.warning("⚠️ Không thể parse ngày: %s", date_str_iso)
                 return [date_str_iso]
             
             # Lấy các giá trị ngày, tháng, năm không có số 0 ở đầu
@@ -3347,21 +3128,20 @@ class GoogleDriveAPI:
             
             return unique_variants
         except Exception as e:
-            print(f"⚠️ Lỗi parse ngày {date_str_iso}: {e}")
+            sheets_log.warning("⚠️ Lỗi parse ngày %s: %s", date_str_iso, e)
             return [date_str_iso]
 
-    def _read_sheet_values(self, spreadsheet_id, sheet_name, a1_range='A1:ZZ1000'):
+    def _read_sheet_values(self, spreadsheet_id, sheet_name, a1_range=TIMESHEET_READ_RANGE):
         """Đọc giá trị từ sheet - CẢI THIỆN: Kiểm tra sheet tồn tại trước với retry logic và rate limiting"""
         import time
-        from datetime import datetime as dt
 
         # Validation đầu vào
         if not spreadsheet_id or not isinstance(spreadsheet_id, str) or not spreadsheet_id.strip():
-            print(f"❌ [READ_SHEET] Spreadsheet ID không hợp lệ: {spreadsheet_id}")
+            sheets_log.error("❌ [READ_SHEET] Spreadsheet ID không hợp lệ: %s", spreadsheet_id)
             return []
 
         if not sheet_name or not isinstance(sheet_name, str) or not sheet_name.strip():
-            print(f"❌ [READ_SHEET] Sheet name không hợp lệ: {sheet_name}")
+            sheets_log.error("❌ [READ_SHEET] Sheet name không hợp lệ: %s", sheet_name)
             return []
 
         # Retry logic với exponential backoff - TĂNG SỐ LẦN VÀ DELAY CHO RATE LIMIT
@@ -3371,48 +3151,37 @@ class GoogleDriveAPI:
 
         for attempt in range(max_retries):
             try:
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 if attempt > 0:
-                    print(f"🔄 [READ_SHEET] Lần thử {attempt + 1}/{max_retries} - {timestamp}")
+                    sheets_log.debug("🔄 [READ_SHEET] Lần thử %s/%s", attempt + 1, max_retries)
 
                 if not self.ensure_valid_token():
-                    print("❌ [READ_SHEET] Không thể đảm bảo token hợp lệ")
+                    sheets_log.error("❌ [READ_SHEET] Không thể đảm bảo token hợp lệ")
                     return []
 
                 if not self.sheets_service:
-                    print("❌ [READ_SHEET] Sheets service không khả dụng")
+                    sheets_log.error("❌ [READ_SHEET] Sheets service không khả dụng")
                     return []
 
-                # Kiểm tra rate limit trước khi gọi API
-                self._check_and_wait_rate_limit()
-
-                # Kiểm tra sheet có tồn tại không - dùng cache nếu có
-                cache_key = f"{spreadsheet_id}:{sheet_name}"
-                if cache_key not in self._sheet_id_cache:
+                # Kiểm tra sheet có tồn tại không - dùng cache chung nếu có
+                cached_sheet_map = drive_metadata_cache.get_sheet_map(spreadsheet_id)
+                if cached_sheet_map is None or sheet_name not in cached_sheet_map:
                     try:
-                        spreadsheet = self.sheets_service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-                        sheets = spreadsheet.get('sheets', [])
-
-                        # Cache tất cả sheet IDs
-                        for sheet in sheets:
-                            title = sheet['properties']['title']
-                            sheet_id = sheet['properties']['sheetId']
-                            key = f"{spreadsheet_id}:{title}"
-                            self._sheet_id_cache[key] = sheet_id
-
-                        if cache_key not in self._sheet_id_cache:
-                            sheet_names = [sheet['properties']['title'] for sheet in sheets]
-                            print(f"⚠️ [READ_SHEET] Sheet '{sheet_name}' không tồn tại trong spreadsheet")
-                            print(f"   📋 Các sheet hiện có: {', '.join(sheet_names)}")
-                            print(f"   ⚠️ Vui lòng tạo sheet '{sheet_name}' trong Google Sheet trước khi cập nhật")
+                        # Cache miss hoặc sheet mới được tạo -> lấy lại danh sách sheet từ API
+                        sheet_map = self.get_sheet_map(spreadsheet_id, force_refresh=True) or {}
+
+                        if sheet_name not in sheet_map:
+                            sheet_names = list(sheet_map.keys())
+                            sheets_log.warning("⚠️ [READ_SHEET] Sheet '%s' không tồn tại trong spreadsheet", sheet_name)
+                            sheets_log.warning("   📋 Các sheet hiện có: %s", ', '.join(sheet_names))
+                            sheets_log.warning("   ⚠️ Vui lòng tạo sheet '%s' trong Google Sheet trước khi cập nhật", sheet_name)
                             return []
                     except Exception as check_err:
                         error_str = str(check_err)
                         # Nếu là lỗi quyền hoặc không tìm thấy, không retry
                         if 'PERMISSION_DENIED' in error_str or 'NOT_FOUND' in error_str:
-                            print(f"❌ [READ_SHEET] Lỗi khi kiểm tra sheet: {error_str}")
+                            sheets_log.error("❌ [READ_SHEET] Lỗi khi kiểm tra sheet: %s", error_str)
                             return []
-                        print(f"⚠️ [READ_SHEET] Không thể kiểm tra sheet tồn tại: {check_err}")
+                        sheets_log.warning("⚠️ [READ_SHEET] Không thể kiểm tra sheet tồn tại: %s", check_err)
                         # Vẫn tiếp tục thử đọc, có thể sheet tồn tại nhưng có lỗi khi check
 
                 # Kiểm tra rate limit trước khi đọc
@@ -3425,14 +3194,12 @@ class GoogleDriveAPI:
                 ).execute()
 
                 values = resp.get('values', [])
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                print(f"✅ [READ_SHEET_SUCCESS] {timestamp} - Đọc thành công {len(values)} dòng từ sheet '{sheet_name}'")
+                sheets_log.info("✅ [READ_SHEET_SUCCESS] Đọc thành công %s dòng từ sheet '%s'", len(values), sheet_name)
                 return values
 
             except Exception as e:
                 error_msg = str(e)
                 error_type = type(e).__name__
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
                 # Phân loại lỗi
                 is_retryable = False
@@ -3440,43 +3207,107 @@ class GoogleDriveAPI:
                 if '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower():
                     is_retryable = True
                     is_rate_limit = True
-                    print(f"⚠️ [READ_SHEET] {timestamp} - Rate limit/quota error (sẽ đợi lâu hơn): {error_msg}")
+                    sheets_log.warning("⚠️ [READ_SHEET] Rate limit/quota error (sẽ đợi lâu hơn): %s", error_msg)
                 elif '503' in error_msg or '500' in error_msg or 'timeout' in error_msg.lower():
                     is_retryable = True
-                    print(f"⚠️ [READ_SHEET] {timestamp} - Server error (có thể retry): {error_msg}")
+                    sheets_log.warning("⚠️ [READ_SHEET] Server error (có thể retry): %s", error_msg)
                 elif 'PERMISSION_DENIED' in error_msg or 'permission' in error_msg.lower():
-                    print(f"❌ [READ_SHEET] {timestamp} - Lỗi quyền truy cập: {error_msg}")
+                    sheets_log.error("❌ [READ_SHEET] Lỗi quyền truy cập: %s", error_msg)
                     return []  # Không retry lỗi quyền
                 elif 'NOT_FOUND' in error_msg or 'not found' in error_msg.lower():
-                    print(f"❌ [READ_SHEET] {timestamp} - Spreadsheet hoặc sheet không tồn tại: {error_msg}")
+                    sheets_log.error("❌ [READ_SHEET] Spreadsheet hoặc sheet không tồn tại: %s", error_msg)
+                    # Spreadsheet có thể đã bị xoá/di chuyển -> bỏ metadata cũ khỏi cache
+                    drive_metadata_cache.invalidate_spreadsheet(spreadsheet_id)
+                    drive_metadata_cache.invalidate_timesheet(spreadsheet_id=spreadsheet_id)
                     return []  # Không retry lỗi không tìm thấy
                 elif 'Unable to parse range' in error_msg or 'does not exist' in error_msg.lower():
-                    print(f"❌ [READ_SHEET] {timestamp} - Sheet '{sheet_name}' không tồn tại trong spreadsheet")
-                    print(f"   ⚠️ Vui lòng tạo sheet '{sheet_name}' trong Google Sheet")
+                    sheets_log.error("❌ [READ_SHEET] Sheet '%s' không tồn tại trong spreadsheet", sheet_name)
+                    drive_metadata_cache.invalidate_spreadsheet(spreadsheet_id)
+                    sheets_log.warning("   ⚠️ Vui lòng tạo sheet '%s' trong Google Sheet", sheet_name)
                     return []  # Không retry lỗi parse range
                 else:
-                    print(f"❌ [READ_SHEET] {timestamp} - Lỗi không xác định: {error_type} - {error_msg}")
+                    sheets_log.error("❌ [READ_SHEET] Lỗi không xác định: %s - %s", error_type, error_msg)
 
                 # Retry nếu có thể
                 if is_retryable and attempt < max_retries - 1:
                     # Đợi lâu hơn nếu là rate limit error
                     if is_rate_limit:
                         wait_time = rate_limit_delay + (attempt * 10)  # 30, 40, 50, 60 giây
+                        google_quota.pause(wait_time)
                     else:
                         wait_time = base_retry_delay * (2 ** attempt)  # 2, 4, 8, 16 giây
-                    print(f"⏳ [READ_SHEET] Đợi {wait_time} giây trước khi retry...")
+                    sheets_log.debug("⏳ [READ_SHEET] Đợi %s giây trước khi retry...", wait_time)
                     time.sleep(wait_time)
                 else:
                     # Không thể retry hoặc đã hết số lần thử
                     import traceback
-                    print(f"❌ [READ_SHEET_FAILED] {timestamp} - Đọc sheet thất bại sau {attempt + 1} lần thử")
-                    print(f"   Error Type: {error_type}")
-                    print(f"   Error Message: {error_msg}")
-                    print(f"   Traceback:\n{traceback.format_exc()}")
+                    sheets_log.error("❌ [READ_SHEET_FAILED] Đọc sheet thất bại sau %s lần thử", attempt + 1)
+                    sheets_log.error("   Error Type: %s", error_type)
+                    sheets_log.error("   Error Message: %s", error_msg)
+                    sheets_log.error("   Traceback:\n%s", traceback.format_exc())
                     return []
         
         return []
 
+    def batch_read_sheet_values(self, spreadsheet_id, sheet_names, a1_range=TIMESHEET_READ_RANGE):
+        """Đọc nhiều sheet của 1 spreadsheet bằng 1 lần values().batchGet.
+
+        Returns:
+            dict {sheet_name: rows}; sheet không đọc được thì không có trong kết quả
+        """
+        import time
+
+        sheet_names = [str(name) for name in sheet_names if name]
+        if not sheet_names:
+            return {}
+
+        max_retries = 5
+        base_retry_delay = 2
+        rate_limit_delay = 30
+
+        for attempt in range(max_retries):
+            try:
+                if not self.ensure_valid_token() or not self.sheets_service:
+                    sheets_log.error("❌ [BATCH_READ_SHEET] Token / Sheets service không khả dụng")
+                    return {}
+
+                self._check_and_wait_rate_limit()
+                resp = self.sheets_service.spreadsheets().values().batchGet(
+                    spreadsheetId=spreadsheet_id,
+                    ranges=[f"{name}!{a1_range}" for name in sheet_names]
+                ).execute()
+
+                # valueRanges trả về đúng thứ tự ranges đã gửi
+                value_ranges = resp.get('valueRanges', [])
+                result = {name: vr.get('values', []) for name, vr in zip(sheet_names, value_ranges)}
+                sheets_log.info("✅ [BATCH_READ_SHEET] Đọc %s sheet trong 1 lần gọi", len(result))
+                return result
+
+            except Exception as e:
+                error_msg = str(e)
+                is_rate_limit = '429' in error_msg or 'quota' in error_msg.lower() or 'rate limit' in error_msg.lower()
+                is_retryable = is_rate_limit or '503' in error_msg or '500' in error_msg or 'timeout' in error_msg.lower()
+                if 'NOT_FOUND' in error_msg or 'not found' in error_msg.lower():
+                    drive_metadata_cache.invalidate_spreadsheet(spreadsheet_id)
+                    drive_metadata_cache.invalidate_timesheet(spreadsheet_id=spreadsheet_id)
+                if 'Unable to parse range' in error_msg:
+                    # 1 sheet không tồn tại làm hỏng cả batchGet -> làm mới danh sách sheet
+                    drive_metadata_cache.invalidate_spreadsheet(spreadsheet_id)
+
+                if is_retryable and attempt < max_retries - 1:
+                    if is_rate_limit:
+                        wait_time = rate_limit_delay + (attempt * 10)
+                        google_quota.pause(wait_time)
+                    else:
+                        wait_time = base_retry_delay * (2 ** attempt)
+                    sheets_log.debug("⏳ [BATCH_READ_SHEET] Lỗi %s - đợi %s giây trước khi retry...", error_msg[:200], wait_time)
+                    time.sleep(wait_time)
+                else:
+                    sheets_log.error("❌ [BATCH_READ_SHEET] Đọc %s sheet thất bại: %s", len(sheet_names), error_msg)
+                    raise
+
+        return {}
+
     def _build_header_map(self, header_row):
         """Xây dựng map từ header row"""
         header_map = {}
@@ -3495,18 +3326,24 @@ class GoogleDriveAPI:
         return None
 
     def _find_row_by_date(self, all_rows, date_str_iso, date_header_index=None):
-        """Tìm dòng theo ngày trong sheet"""
-        variants = self._date_variants(date_str_iso)
+        """Tìm dòng theo ngày trong sheet.
+
+        all_rows: SheetIndex (dựng 1 lần cho mỗi sheet, tra O(1)) hoặc list dòng thô.
+        Chỉ khi tra trượt mới dò chuỗi biến thể ngày trên các ô ngày không parse được.
+        """
         date_col_index = date_header_index if date_header_index is not None else 0
-        
-        for i, row in enumerate(all_rows):
-            if len(row) <= date_col_index:
-                continue
-            cell_value = str(row[date_col_index]).strip()
-            for variant in variants:
-                if variant in cell_value:
-                    return i + 1  # Trả về số dòng (1-based)
-        print(f"❌ Không tìm thấy dòng phù hợp")
+        index = all_rows if isinstance(all_rows, SheetIndex) else SheetIndex(all_rows, date_col_index)
+
+        row_number = index.row_for(date_str_iso)
+        if row_number:
+            return row_number
+
+        if index.unparsed:
+            variants = self._date_variants(date_str_iso)
+            for row_number, cell_value in index.unparsed:
+                if any(variant in cell_value for variant in variants):
+                    return row_number
+        sheets_log.error("❌ Không tìm thấy dòng phù hợp")
         return None
 
     def update_timesheet_for_attendance(self, spreadsheet_id, sheet_name, attendance_data):
@@ -3518,89 +3355,72 @@ class GoogleDriveAPI:
         """
         import sys
         from datetime import datetime as dt
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         
-        # Helper function for safe logging
-        def _log(msg):
-            try:
-                # Use sys.stderr which is less likely to be buffered/closed than stdout
-                # and ignore errors if it is closed
-                import sys
-                print(msg, file=sys.stderr, flush=True)
-            except Exception:
-                pass
-
         try:
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
             
             # VALIDATION ĐẦU VÀO - Đảm bảo 100% không lỗi
             if not spreadsheet_id or not isinstance(spreadsheet_id, str) or not spreadsheet_id.strip():
-                _log(f"❌ [UPDATE_TIMESHEET] {timestamp} - Spreadsheet ID không hợp lệ: {spreadsheet_id}")
+                sheets_log.error("❌ [UPDATE_TIMESHEET] Spreadsheet ID không hợp lệ: %s", spreadsheet_id)
                 return False
             
             if not sheet_name or not isinstance(sheet_name, str) or not sheet_name.strip():
-                _log(f"❌ [UPDATE_TIMESHEET] {timestamp} - Sheet name không hợp lệ: {sheet_name}")
+                sheets_log.error("❌ [UPDATE_TIMESHEET] Sheet name không hợp lệ: %s", sheet_name)
                 return False
             
             if not attendance_data or not isinstance(attendance_data, dict):
-                _log(f"❌ [UPDATE_TIMESHEET] {timestamp} - Attendance data không hợp lệ hoặc rỗng")
+                sheets_log.error("❌ [UPDATE_TIMESHEET] Attendance data không hợp lệ hoặc rỗng")
                 return False
             
             # Kiểm tra date có tồn tại và hợp lệ không
             date_str = attendance_data.get('date', '')
             if not date_str:
-                _log(f"❌ [UPDATE_TIMESHEET] {timestamp} - Attendance data thiếu 'date'")
+                sheets_log.error("❌ [UPDATE_TIMESHEET] Attendance data thiếu 'date'")
                 return False
             
             try:
                 # Validate date format
                 dt.strptime(date_str, "%Y-%m-%d")
             except ValueError:
-                _log(f"❌ [UPDATE_TIMESHEET] {timestamp} - Date format không hợp lệ: {date_str} (cần YYYY-MM-DD)")
+                sheets_log.error("❌ [UPDATE_TIMESHEET] Date format không hợp lệ: %s (cần YYYY-MM-DD)", date_str)
                 return False
             
-            _log(f"\n{'='*80}")
-            _log(f"🚀 [UPDATE_TIMESHEET_START] {timestamp} - Bắt đầu cập nhật timesheet")
-            _log(f"   📊 Spreadsheet ID: {spreadsheet_id}")
-            _log(f"   📋 Sheet Name: {sheet_name}")
-            _log(f"   📅 Date: {attendance_data.get('date', 'Unknown')}")
-            _log(f"   👤 Employee: {attendance_data.get('user_name', 'Unknown')}")
-            _log(f"{'='*80}")
+            sheets_log.debug("🚀 [UPDATE_TIMESHEET_START] Bắt đầu cập nhật timesheet")
+            sheets_log.debug("   📊 Spreadsheet ID: %s", spreadsheet_id)
+            sheets_log.debug("   📋 Sheet Name: %s", sheet_name)
+            sheets_log.debug("   📅 Date: %s", attendance_data.get('date', 'Unknown'))
+            sheets_log.debug("   👤 Employee: %s", attendance_data.get('user_name', 'Unknown'))
 
             # Đảm bảo bộ sao lưu định kỳ đã chạy nền
             try:
                 ensure_backup_scheduler_started()
             except Exception as _e:
-                _log(f"⚠️ Không thể khởi động backup scheduler: {_e}")
+                sheets_log.warning("⚠️ Không thể khởi động backup scheduler: %s", _e)
             
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            _log(f"🔍 [TOKEN_CHECK] {timestamp} - Kiểm tra token...")
+            sheets_log.debug("🔍 [TOKEN_CHECK] Kiểm tra token...")
             
             if not self.ensure_valid_token():
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                _log(f"❌ [TOKEN_INVALID] {timestamp} - Không thể đảm bảo token hợp lệ")
+                sheets_log.error("❌ [TOKEN_INVALID] Không thể đảm bảo token hợp lệ")
                 return False
 
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            _log(f"✅ [TOKEN_VALID] {timestamp} - Token hợp lệ")
-            _log(f"🔍 [READ_SHEET] {timestamp} - Đang đọc dữ liệu từ sheet...")
+            sheets_log.info("✅ [TOKEN_VALID] Token hợp lệ")
+            sheets_log.debug("🔍 [READ_SHEET] Đang đọc dữ liệu từ sheet...")
             
             rows = self._read_sheet_values(spreadsheet_id, sheet_name)
             
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            _log(f"📊 [READ_SHEET_DONE] {timestamp} - Số dòng đọc được: {len(rows)}")
+            sheets_log.debug("📊 [READ_SHEET_DONE] Số dòng đọc được: %s", len(rows))
             
             if not rows:
-                _log("⚠️ Không đọc được dữ liệu sheet, fallback về 1 ô")
+                sheets_log.warning("⚠️ Không đọc được dữ liệu sheet, fallback về 1 ô")
                 return self.update_sheet_value(
                     spreadsheet_id, sheet_name, 35, 'M',
                     f"Phê duyệt bởi {attendance_data.get('approved_by','')} - {attendance_data.get('approved_at','')}"
                 )
 
-            _log(f"📋 Header row: {rows[0] if rows else 'Empty'}")
-            header = rows[0]
-            header_map = self._build_header_map(header)
-            _log(f"🗺️ Header map: {header_map}")
+            sheets_log.debug("📋 Header row: %s", (rows[0] if rows else 'Empty'))
+            # Chỉ mục ngày -> dòng + header map, dựng 1 lần cho sheet vừa đọc
+            sheet_index = SheetIndex(rows, 0)
+            header_map = sheet_index.header_map
+            sheets_log.debug("🗺️ Header map: %s", header_map)
 
             # Xác định cột ngày và dòng tương ứng với ngày
             # Dựa trên cấu trúc thực tế: cột A (index 0) chứa ngày theo format 2025/10/13
@@ -3608,47 +3428,43 @@ class GoogleDriveAPI:
             # Cột A luôn là cột ngày (index 0) trong timesheet
             date_col_index = 0
             
-            _log(f"🔍 Tìm dòng theo ngày: {date_iso}")
-            _log(f"📅 Các biến thể ngày: {self._date_variants(date_iso)}")
-            _log(f"🎯 Tìm kiếm trong cột {date_col_index} (cột A)")
+            sheets_log.debug("🔍 Tìm dòng theo ngày: %s", date_iso)
+            sheets_log.debug("🎯 Tìm kiếm trong cột %s (cột A)", date_col_index)
             
-            target_row_index = self._find_row_by_date(rows, date_iso, date_col_index)
+            target_row_index = self._find_row_by_date(sheet_index, date_iso, date_col_index)
             
             if target_row_index:
-                _log(f"✅ Tìm thấy dòng {target_row_index} cho ngày {date_iso}")
+                sheets_log.info("✅ Tìm thấy dòng %s cho ngày %s", target_row_index, date_iso)
             else:
-                _log(f"❌ Không tìm thấy dòng cho ngày {date_iso}")
+                sheets_log.error("❌ Không tìm thấy dòng cho ngày %s", date_iso)
                 # Debug: in ra một vài dòng đầu để kiểm tra
-                _log("📋 Một vài dòng đầu trong sheet:")
+                sheets_log.debug("📋 Một vài dòng đầu trong sheet:")
                 for i, row in enumerate(rows[:15]):
                     if len(row) > 0:
-                        _log(f"   Dòng {i+1}: '{row[0] if len(row) > 0 else 'Empty'}'")
+                        sheets_log.debug("   Dòng %s: '%s'", i + 1, (row[0] if len(row) > 0 else 'Empty'))
                 
                 # Debug: tìm kiếm thủ công trong cột A
-                _log(f"🔍 Tìm kiếm thủ công ngày {date_iso} trong cột A:")
+                sheets_log.debug("🔍 Tìm kiếm thủ công ngày %s trong cột A:", date_iso)
                 for i, row in enumerate(rows):
                     if len(row) > 0 and row[0]:
                         cell_value = str(row[0]).strip()
                         if date_iso in cell_value or any(variant in cell_value for variant in self._date_variants(date_iso)):
-                            _log(f"   ✅ Tìm thấy khớp ở dòng {i+1}: '{cell_value}'")
+                            sheets_log.debug("   ✅ Tìm thấy khớp ở dòng %s: '%s'", i + 1, cell_value)
                         elif '2025' in cell_value and '10' in cell_value and '13' in cell_value:
-                            _log(f"   🔍 Có thể khớp ở dòng {i+1}: '{cell_value}'")
+                            sheets_log.debug("   🔍 Có thể khớp ở dòng %s: '%s'", i + 1, cell_value)
 
             if not target_row_index:
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                _log(f"\n{'='*80}")
-                _log(f"❌ [ROW_NOT_FOUND] {timestamp} - KHÔNG TÌM THẤY DÒNG THEO NGÀY")
-                _log(f"   Date: {date_iso}")
-                _log(f"   Sheet: {sheet_name}")
-                _log(f"   Spreadsheet ID: {spreadsheet_id}")
-                _log(f"   Số dòng trong sheet: {len(rows)}")
-                _log(f"   ⚠️ Fallback về cập nhật 1 ô (M35)")
-                _log(f"{'='*80}\n")
+                sheets_log.error("❌ [ROW_NOT_FOUND] KHÔNG TÌM THẤY DÒNG THEO NGÀY")
+                sheets_log.error("   Date: %s", date_iso)
+                sheets_log.error("   Sheet: %s", sheet_name)
+                sheets_log.error("   Spreadsheet ID: %s", spreadsheet_id)
+                sheets_log.error("   Số dòng trong sheet: %s", len(rows))
+                sheets_log.warning("   ⚠️ Fallback về cập nhật 1 ô (M35)")
                 result = self.update_sheet_value(
                     spreadsheet_id, sheet_name, 35, 'M',
                     f"Phê duyệt bởi {attendance_data.get('approved_by','')} - {attendance_data.get('approved_at','')}"
                 )
-                _log(f"📊 [FALLBACK_UPDATE] Kết quả fallback: {result}")
+                sheets_log.debug("📊 [FALLBACK_UPDATE] Kết quả fallback: %s", result)
                 return result
 
             # Mapping cột cụ thể theo yêu cầu
@@ -3714,11 +3530,11 @@ class GoogleDriveAPI:
                     update_ranges.append(a1)  # Lưu range để căn giữa
 
             # Tính tổng giờ nghỉ + đối ứng (cột E)
-            print(f"\n🧮 TÍNH TOÁN DỮ LIỆU:")
+            sheets_log.debug("🧮 TÍNH TOÁN DỮ LIỆU:")
             break_time = attendance_data.get('break_time', '0:00')
             doi_ung_total = attendance_data.get('doi_ung_total', '0:00')  # HH:MM tổng đối ứng
-            print(f"   ⏰ Giờ nghỉ: {break_time}")
-            print(f"   🔄 Tổng đối ứng: {doi_ung_total}")
+            sheets_log.debug("   ⏰ Giờ nghỉ: %s", break_time)
+            sheets_log.debug("   🔄 Tổng đối ứng: %s", doi_ung_total)
             
             # Chuyển đổi giờ nghỉ và đối ứng sang phút để cộng
             def hhmm_to_minutes(hhmm_str):
@@ -3742,11 +3558,11 @@ class GoogleDriveAPI:
             total_break_comp_minutes = break_minutes + doi_ung_minutes
             total_break_comp_hhmm = minutes_to_hhmm(total_break_comp_minutes)
             
-            print(f"   📊 Giờ nghỉ (phút): {break_minutes}")
-            print(f"   📊 Tổng đối ứng (phút): {doi_ung_minutes}")
-            print(f"   📊 Tổng nghỉ + đối ứng: {total_break_comp_hhmm}")
+            sheets_log.debug("   📊 Giờ nghỉ (phút): %s", break_minutes)
+            sheets_log.debug("   📊 Tổng đối ứng (phút): %s", doi_ung_minutes)
+            sheets_log.debug("   📊 Tổng nghỉ + đối ứng: %s", total_break_comp_hhmm)
 
-            print(f"\n📝 CHUẨN BỊ CẬP NHẬT CÁC CỘT:")
+            sheets_log.debug("📝 CHUẨN BỊ CẬP NHẬT CÁC CỘT:")
             
             # PHÂN BIỆT CÁC LOẠI NGÀY ĐỂ MAPPING CHÍNH XÁC
             holiday_type = attendance_data.get('holiday_type')
@@ -3756,27 +3572,27 @@ class GoogleDriveAPI:
             is_japanese_holiday = holiday_type == 'japanese_holiday'
             is_normal_day = not holiday_type or holiday_type == 'normal'
             
-            print(f"   📅 Loại ngày: {holiday_type or 'normal'}")
-            print(f"   🔸 Weekend: {is_weekend}")
-            print(f"   🔸 Lễ Việt Nam: {is_vietnamese_holiday}")
-            print(f"   🔸 Lễ Nhật: {is_japanese_holiday}")
-            print(f"   🔸 Ngày thường: {is_normal_day}")
+            sheets_log.debug("   📅 Loại ngày: %s", holiday_type or 'normal')
+            sheets_log.debug("   🔸 Weekend: %s", is_weekend)
+            sheets_log.debug("   🔸 Lễ Việt Nam: %s", is_vietnamese_holiday)
+            sheets_log.debug("   🔸 Lễ Nhật: %s", is_japanese_holiday)
+            sheets_log.debug("   🔸 Ngày thường: %s", is_normal_day)
             
             # Với ngày cuối tuần: regular_work_hours = 0, overtime đã được tính đúng trong database
             # Chỉ cần đảm bảo regular_work_hours = 0:00 khi mapping lên Google Sheets
             if is_weekend:
-                print(f"   ⚠️ [WEEKEND_LOGIC] Ngày cuối tuần - điều chỉnh mapping:")
-                print(f"      - Regular work hours sẽ = 0:00 (đảm bảo)")
-                print(f"      - Overtime giữ nguyên từ database (đã tính đúng)")
+                sheets_log.warning("   ⚠️ [WEEKEND_LOGIC] Ngày cuối tuần - điều chỉnh mapping:")
+                sheets_log.warning("      - Regular work hours sẽ = 0:00 (đảm bảo)")
+                sheets_log.warning("      - Overtime giữ nguyên từ database (đã tính đúng)")
                 
                 # Đảm bảo regular_work_hours = 0:00 cho weekend
                 # Database đã tính đúng overtime rồi, không cần tính lại
                 attendance_data['regular_work_hours'] = '0:00'
                 
                 # Log để kiểm tra
-                print(f"      ✅ Đã set regular_work_hours = 0:00")
-                print(f"      📊 Overtime before 22h: {attendance_data.get('overtime_before_22', '0:00')}")
-                print(f"      📊 Overtime after 22h: {attendance_data.get('overtime_after_22', '0:00')}")
+                sheets_log.debug("      ✅ Đã set regular_work_hours = 0:00")
+                sheets_log.debug("      📊 Overtime before 22h: %s", attendance_data.get('overtime_before_22', '0:00'))
+                sheets_log.debug("      📊 Overtime after 22h: %s", attendance_data.get('overtime_after_22', '0:00'))
 
             def _is_full_leave_day(raw_value):
                 """Chỉ xem là nghỉ tròn ngày khi giá trị thực sự biểu thị 1.0 ngày."""
@@ -3846,7 +3662,7 @@ class GoogleDriveAPI:
             # Nếu là ngày nghỉ tròn 1 ngày (full_leave_day) → xóa sạch các cột thời gian G,H,I,J,K,M
             full_leave_day = _is_full_leave_day(attendance_data.get('full_leave_day'))
             if full_leave_day and not memo_only:
-                _log("   🔸 Full leave day: clearing columns G,H,I,J,K,M")
+                sheets_log.debug("   🔸 Full leave day: clearing columns G,H,I,J,K,M")
                 for col_letter in ['G', 'H', 'I', 'J', 'K', 'M']:
                     a1 = f"{sheet_name}!{col_letter}{target_row_index}"
                     updates.append({'range': a1, 'values': [['']]})
@@ -3857,18 +3673,18 @@ class GoogleDriveAPI:
 
                     if memo_only:
                         # Chế độ chỉ memo (ví dụ: nghỉ 30 phút) → không đụng vào E,G,K,M,N,O
-                        print("   🔸 Chế độ memo_only: chỉ cập nhật cột P (Memo), bỏ qua các cột thời gian")
+                        sheets_log.debug("   🔸 Chế độ memo_only: chỉ cập nhật cột P (Memo), bỏ qua các cột thời gian")
                     else:
                         # Nếu là nghỉ 0.5 ngày: xử lý đặc biệt để phân biệt nghỉ sáng/chiều
                         if not is_half_day:
                             # Ngày làm bình thường / các loại khác: cập nhật đầy đủ
-                            print(f"   🔸 Cột G (Giờ vào): {attendance_data.get('check_in')}")
+                            sheets_log.debug("   🔸 Cột G (Giờ vào): %s", attendance_data.get('check_in'))
                             add_update('check_in', attendance_data.get('check_in'))
                             
-                            print(f"   🔸 Cột K (Giờ ra): {attendance_data.get('check_out')}")
+                            sheets_log.debug("   🔸 Cột K (Giờ ra): %s", attendance_data.get('check_out'))
                             add_update('check_out', attendance_data.get('check_out'))
                             
-                            print(f"   🔸 Cột M (Giờ công): {attendance_data.get('regular_work_hours')}")
+                            sheets_log.debug("   🔸 Cột M (Giờ công): %s", attendance_data.get('regular_work_hours'))
                             # Cột M luôn được cập nhật, kể cả khi giá trị là 0:00
                             regular_work_hours_value = attendance_data.get('regular_work_hours')
                             col_letter = column_mapping.get('regular_work_hours')
@@ -3877,7 +3693,7 @@ class GoogleDriveAPI:
                                 updates.append({'range': a1, 'values': [[str(regular_work_hours_value or '0:00')]]})
                                 update_ranges.append(a1)
                         else:
-                            print(f"   🔸 Ngày nghỉ 0.5: xử lý phân biệt sáng/chiều theo ca làm việc (Shift Code: {attendance_data.get('shift_code')})")
+                            sheets_log.debug("   🔸 Ngày nghỉ 0.5: xử lý phân biệt sáng/chiều theo ca làm việc (Shift Code: %s)", attendance_data.get('shift_code'))
 
                             # ==================================================================================
                             # LOGIC XỬ LÝ 0.5 NGÀY CHO 4 CA (1, 2, 3, 4)
@@ -3894,7 +3710,7 @@ class GoogleDriveAPI:
                             shift_code = str(attendance_data.get('shift_code', '1'))
                             # Nếu shift code không hợp lệ thì mặc định là 1 (hoặc giữ nguyên logic cũ nếu muốn an toàn hơn)
                             if shift_code not in shift_config:
-                                print(f"   ⚠️ Shift code '{shift_code}' không hợp lệ, mặc định dùng Ca 1")
+                                sheets_log.warning("   ⚠️ Shift code '%s' không hợp lệ, mặc định dùng Ca 1", shift_code)
                                 shift_code = '1'
                                 
                             info = shift_config[shift_code]
@@ -3928,8 +3744,8 @@ class GoogleDriveAPI:
                             leave_end_str = attendance_data.get('leave_end_time')
                             minutes_end = _time_to_minutes(leave_end_str)
                             
-                            print(f"   🔍 [DETECT] minutes_start={minutes_start}, minutes_end={minutes_end}")
-                            print(f"   🔍 [SHIFT] start={m_start}, lunch_start={m_lunch_start}, lunch_end={m_lunch_end}, end={m_end}")
+                            sheets_log.debug("   🔍 [DETECT] minutes_start=%s, minutes_end=%s", minutes_start, minutes_end)
+                            sheets_log.debug("   🔍 [SHIFT] start=%s, lunch_start=%s, lunch_end=%s, end=%s", m_start, m_lunch_start, m_lunch_end, m_end)
                             
                             if minutes_start is not None:
                                 tolerance = 30 # Cho phép lệch 30 phút
@@ -3956,7 +3772,7 @@ class GoogleDriveAPI:
                                         is_morning_leave = True
                                 
                                 if is_morning_leave:
-                                    print(f"   ✅ Phát hiện: Nghỉ Sáng (Ca {shift_code})")
+                                    sheets_log.debug("   ✅ Phát hiện: Nghỉ Sáng (Ca %s)", shift_code)
                                     final_g = info['lunch_end']
                                     final_k = info['end']
                                     final_e = '0:00'
@@ -4011,13 +3827,13 @@ class GoogleDriveAPI:
                     if is_half_day:
                         # Kiểm tra xem logic 0.5 ngày ở trên đã tính E chưa
                         if 'final_e' in locals() and final_e is not None:
-                            print(f"   🔸 Cột E (Tổng nghỉ + đối ứng): Đã tính toán theo logic 0.5 ngày → set {final_e}")
+                            sheets_log.debug("   🔸 Cột E (Tổng nghỉ + đối ứng): Đã tính toán theo logic 0.5 ngày → set %s", final_e)
                             break_comp_cell_value = final_e
                         else:
-                            print("   🔸 Cột E (Tổng nghỉ + đối ứng): phát hiện nghỉ 0.5 ngày (fallback) → set 0:00")
+                            sheets_log.debug("   🔸 Cột E (Tổng nghỉ + đối ứng): phát hiện nghỉ 0.5 ngày (fallback) → set 0:00")
                             break_comp_cell_value = '0:00'
                     else:
-                        print(f"   🔸 Cột E (Tổng nghỉ + đối ứng): {break_comp_cell_value}")
+                        sheets_log.debug("   🔸 Cột E (Tổng nghỉ + đối ứng): %s", break_comp_cell_value)
                     
                     # Cột E chỉ được cập nhật khi KHÔNG PHẢI memo_only (nghỉ 30 phút)
                     if not memo_only:
@@ -4028,18 +3844,18 @@ class GoogleDriveAPI:
                             updates.append({'range': a1_e, 'values': [[str(break_comp_cell_value or '0:00')]]})
                             update_ranges.append(a1_e)
                     else:
-                        print("   🔸 Cột E (Tổng nghỉ + đối ứng): BỎ QUA cập nhật (memo_only mode)")
+                        sheets_log.debug("   🔸 Cột E (Tổng nghỉ + đối ứng): BỎ QUA cập nhật (memo_only mode)")
 
                     
                     
                     # Cập nhật OT (N, O) nếu có dữ liệu
                     # Cho phép cập nhật ngay cả khi nghỉ 0.5 ngày (vì nửa ngày còn lại có thể tăng ca)
                     if attendance_data.get('overtime_before_22'):
-                        print(f"   🔸 Cột N (Tăng ca <22h): {attendance_data.get('overtime_before_22')}")
+                        sheets_log.debug("   🔸 Cột N (Tăng ca <22h): %s", attendance_data.get('overtime_before_22'))
                         add_update('overtime_before_22', attendance_data.get('overtime_before_22'))
                     
                     if attendance_data.get('overtime_after_22'):
-                        print(f"   🔸 Cột O (Tăng ca >22h): {attendance_data.get('overtime_after_22')}")
+                        sheets_log.debug("   🔸 Cột O (Tăng ca >22h): %s", attendance_data.get('overtime_after_22'))
                         add_update('overtime_after_22', attendance_data.get('overtime_after_22'))
 
             # Ghi chú số ngày nghỉ (nếu có) - đọc giá trị hiện tại và nối thêm nếu có
@@ -4063,13 +3879,13 @@ class GoogleDriveAPI:
                 else:
                     final_p_value = leave_summary_value
                 
-                print(f"   🔸 Cột P (Ghi chú):")
-                print(f"      - Giá trị hiện tại: {current_p_value or '(trống)'}")
-                print(f"      - Thêm mới: {leave_summary_value}")
-                print(f"      - Giá trị cuối: {final_p_value}")
+                sheets_log.debug("   🔸 Cột P (Ghi chú):")
+                sheets_log.debug("      - Giá trị hiện tại: %s", current_p_value or '(trống)')
+                sheets_log.debug("      - Thêm mới: %s", leave_summary_value)
+                sheets_log.debug("      - Giá trị cuối: %s", final_p_value)
                 add_update('leave_summary', final_p_value)
             else:
-                print(f"   🔸 Cột P (Ghi chú): Không có nội dung mới")
+                sheets_log.debug("   🔸 Cột P (Ghi chú): Không có nội dung mới")
             
             # Xử lý trừ giờ nghỉ trưa nếu có nghỉ phép và không phải full leave day (Áp dụng cho cả nghỉ 0.5 ngày)
             use_lunch_break = attendance_data.get('use_lunch_break')
@@ -4135,9 +3951,9 @@ class GoogleDriveAPI:
                                     LeaveRequest.status == 'approved'
                                 ).first()
                                 
-                                print(f"\n   🔍 [LOGIC NGHỈ 0.5 NGÀY] Checking LeaveRequest for {current_user_id} on {target_date}:")
+                                sheets_log.debug("   🔍 [LOGIC NGHỈ 0.5 NGÀY] Checking LeaveRequest for %s on %s:", current_user_id, target_date)
                                 if lr:
-                                    print(f"      - Leave Time: {lr.leave_from_hour}:{lr.leave_from_minute:02d} -> {lr.leave_to_hour}:{lr.leave_to_minute:02d}")
+                                    sheets_log.debug("      - Leave Time: %s:%02d -> %s:%02d", lr.leave_from_hour, lr.leave_from_minute, lr.leave_to_hour, lr.leave_to_minute)
                                     
                                     # LOGIC MỚI: Dựa theo ca làm việc (Shift) thay vì cứng nhắc 13h
                                     # Lấy thông tin shift hiện tại
@@ -4157,21 +3973,21 @@ class GoogleDriveAPI:
                                     tol = 30
                                     if abs(lr_start_mins - s_start_mins) <= tol:
                                         is_morning_leave_detected = True
-                                        print(f"      => KẾT LUẬN: NGHỈ BUỔI SÁNG (Starts at shift start)")
+                                        sheets_log.debug("      => KẾT LUẬN: NGHỈ BUỔI SÁNG (Starts at shift start)")
                                     elif lr_end_mins <= s_lunch_end_mins + tol:
                                         is_morning_leave_detected = True
-                                        print(f"      => KẾT LUẬN: NGHỈ BUỔI SÁNG (Ends by lunch end)")
+                                        sheets_log.debug("      => KẾT LUẬN: NGHỈ BUỔI SÁNG (Ends by lunch end)")
                                     else:
-                                        print(f"      => KẾT LUẬN: NGHỈ BUỔI CHIỀU")
+                                        sheets_log.debug("      => KẾT LUẬN: NGHỈ BUỔI CHIỀU")
                                 else:
-                                    print(f"      ⚠️ Không tìm thấy LeaveRequest trong DB. Mặc định dùng logic based on lunch break choice.")
+                                    sheets_log.warning("      ⚠️ Không tìm thấy LeaveRequest trong DB. Mặc định dùng logic based on lunch break choice.")
                             else:
-                                print(f"      ⚠️ Không có user_id trong attendance_data. Bỏ qua tra cứu DB.")
+                                sheets_log.warning("      ⚠️ Không có user_id trong attendance_data. Bỏ qua tra cứu DB.")
                                 
                         except Exception as lr_err:
-                            print(f"   ⚠️ Lỗi truy vấn DB kiểm tra loại nghỉ: {lr_err}")
+                            sheets_log.warning("   ⚠️ Lỗi truy vấn DB kiểm tra loại nghỉ: %s", lr_err)
 
-                        print(f"   📊 [GOOGLE SHEET UPDATE PLAN]")
+                        sheets_log.debug("   📊 [GOOGLE SHEET UPDATE PLAN]")
                         
                         # 2. XỬ LÝ CẬP NHẬT SHEET
                         if is_morning_leave_detected:
@@ -4186,10 +4002,10 @@ class GoogleDriveAPI:
                             if new_g_minutes < 0: new_g_minutes = 0
                             new_g_value = minutes_to_hhmm(new_g_minutes)
                             
-                            print(f"      🔹 TRƯỜNG HỢP: NGHỈ SÁNG (Đi làm ca chiều)")
-                            print(f"      - Giờ ra (Cột K): {current_k_value} (Giữ nguyên)")
-                            print(f"      - Giờ vào (Cột G): Sẽ cập nhật thành {new_g_value} (Logic: Ra - 4h làm)")
-                            print(f"      - Giờ nghỉ (Cột E): Sẽ cập nhật thành {new_e_value}")
+                            sheets_log.debug("      🔹 TRƯỜNG HỢP: NGHỈ SÁNG (Đi làm ca chiều)")
+                            sheets_log.debug("      - Giờ ra (Cột K): %s (Giữ nguyên)", current_k_value)
+                            sheets_log.debug("      - Giờ vào (Cột G): Sẽ cập nhật thành %s (Logic: Ra - 4h làm)", new_g_value)
+                            sheets_log.debug("      - Giờ nghỉ (Cột E): Sẽ cập nhật thành %s", new_e_value)
                             
                             # Update G
                             a1_g = f"{sheet_name}!G{target_row_index}"
@@ -4211,11 +4027,11 @@ class GoogleDriveAPI:
                             
                             new_e_value = '1:00' if use_lunch_break else '0:00'
                             
-                            print(f"      🔹 TRƯỜNG HỢP: NGHỈ CHIỀU (Đi làm ca sáng)")
-                            print(f"      - User chọn ăn trưa: {'CÓ' if use_lunch_break else 'KHÔNG'}")
-                            print(f"      - Giờ vào (Cột G): (Giữ nguyên)")
-                            print(f"      - Giờ ra (Cột K): {current_k_value} -> {new_k_value} (Trừ {lunch_break_hours}h)")
-                            print(f"      - Giờ nghỉ (Cột E): Sẽ cập nhật thành {new_e_value}")
+                            sheets_log.debug("      🔹 TRƯỜNG HỢP: NGHỈ CHIỀU (Đi làm ca sáng)")
+                            sheets_log.debug("      - User chọn ăn trưa: %s", ('CÓ' if use_lunch_break else 'KHÔNG'))
+                            sheets_log.debug("      - Giờ vào (Cột G): (Giữ nguyên)")
+                            sheets_log.debug("      - Giờ ra (Cột K): %s -> %s (Trừ %sh)", current_k_value, new_k_value, lunch_break_hours)
+                            sheets_log.debug("      - Giờ nghỉ (Cột E): Sẽ cập nhật thành %s", new_e_value)
                             
                             # Update K
                             a1_k = f"{sheet_name}!K{target_row_index}"
@@ -4230,12 +4046,12 @@ class GoogleDriveAPI:
                             updates.append({'range': a1_e, 'values': [[new_e_value]]})
                             update_ranges.append(a1_e)
                             
-                        print(f"   ✅ Đã thêm các cập nhật vào hàng đợi batch update.\n")
+                        sheets_log.debug("   ✅ Đã thêm các cập nhật vào hàng đợi batch update.")
 
                     except Exception as k_err:
-                        print(f"   ⚠️ Lỗi logic tính toán cập nhật Sheet: {k_err}")
+                        sheets_log.warning("   ⚠️ Lỗi logic tính toán cập nhật Sheet: %s", k_err)
                 else:
-                    print(f"   ⚠️ Cột K (Giờ ra) không có dữ liệu, không thể tính toán điều chỉnh giờ.")
+                    sheets_log.warning("   ⚠️ Cột K (Giờ ra) không có dữ liệu, không thể tính toán điều chỉnh giờ.")
 
             # Xử lý đơn đi trễ/về sớm: trừ giờ từ cột G (đi trễ) hoặc cột K (về sớm)
             late_early_type = attendance_data.get('late_early_type')
@@ -4265,9 +4081,9 @@ class GoogleDriveAPI:
                     minutes = total_minutes % 60
                     return f"{hours}:{minutes:02d}"
 
-                print(f"\n   🔸 Xử lý đơn đi trễ/về sớm:")
-                print(f"      - Loại: {late_early_type}")
-                print(f"      - Số phút: {late_early_minutes}")
+                sheets_log.debug("   🔸 Xử lý đơn đi trễ/về sớm:")
+                sheets_log.debug("      - Loại: %s", late_early_type)
+                sheets_log.debug("      - Số phút: %s", late_early_minutes)
 
                 if late_early_type == 'late':
                     # Đi trễ: CỘNG giờ vào cột G (đi trễ) - vì đến muộn hơn
@@ -4286,18 +4102,18 @@ class GoogleDriveAPI:
                             
                             new_g_value = minutes_to_hhmm_le(new_g_minutes)
                             
-                            print(f"      - Cột G (Giờ vào) hiện tại: {current_g_value or '0:00'} ({current_g_minutes} phút)")
-                            print(f"      - Cộng: {late_early_minutes} phút (đi trễ)")
-                            print(f"      - Cột G mới: {new_g_value} ({new_g_minutes} phút)")
+                            sheets_log.debug("      - Cột G (Giờ vào) hiện tại: %s (%s phút)", current_g_value or '0:00', current_g_minutes)
+                            sheets_log.debug("      - Cộng: %s phút (đi trễ)", late_early_minutes)
+                            sheets_log.debug("      - Cột G mới: %s (%s phút)", new_g_value, new_g_minutes)
                             
                             # Cập nhật lại cột G
                             a1_g = f"{sheet_name}!G{target_row_index}"
                             updates.append({'range': a1_g, 'values': [[new_g_value]]})
                             update_ranges.append(a1_g)
                         except Exception as g_err:
-                            print(f"      ⚠️ Lỗi khi xử lý cột G: {g_err}")
+                            sheets_log.warning("      ⚠️ Lỗi khi xử lý cột G: %s", g_err)
                     else:
-                        print(f"      ⚠️ Cột G không có giá trị hoặc bằng 0, bỏ qua xử lý đi trễ")
+                        sheets_log.warning("      ⚠️ Cột G không có giá trị hoặc bằng 0, bỏ qua xử lý đi trễ")
 
                 elif late_early_type == 'early':
                     # Về sớm: trừ giờ từ cột K (Giờ ra)
@@ -4319,68 +4135,57 @@ class GoogleDriveAPI:
                             
                             new_k_value = minutes_to_hhmm_le(new_k_minutes)
                             
-                            print(f"      - Cột K (Giờ ra) hiện tại: {current_k_value or '0:00'} ({current_k_minutes} phút)")
-                            print(f"      - Trừ: {late_early_minutes} phút")
-                            print(f"      - Cột K mới: {new_k_value} ({new_k_minutes} phút)")
+                            sheets_log.debug("      - Cột K (Giờ ra) hiện tại: %s (%s phút)", current_k_value or '0:00', current_k_minutes)
+                            sheets_log.debug("      - Trừ: %s phút", late_early_minutes)
+                            sheets_log.debug("      - Cột K mới: %s (%s phút)", new_k_value, new_k_minutes)
                             
                             # Cập nhật lại cột K
                             a1_k = f"{sheet_name}!K{target_row_index}"
                             updates.append({'range': a1_k, 'values': [[new_k_value]]})
                             update_ranges.append(a1_k)
                         except Exception as k_err:
-                            print(f"      ⚠️ Lỗi khi xử lý cột K: {k_err}")
+                            sheets_log.warning("      ⚠️ Lỗi khi xử lý cột K: %s", k_err)
                     else:
-                        print(f"      ⚠️ Cột K không có giá trị hoặc bằng 0, bỏ qua xử lý về sớm")
+                        sheets_log.warning("      ⚠️ Cột K không có giá trị hoặc bằng 0, bỏ qua xử lý về sớm")
 
-            _log(f"\n📊 TỔNG KẾT CẬP NHẬT:")
-            _log(f"   📝 Số ô sẽ cập nhật: {len(updates)}")
+            sheets_log.debug("📊 TỔNG KẾT CẬP NHẬT:")
+            sheets_log.debug("   📝 Số ô sẽ cập nhật: %s", len(updates))
             for i, update in enumerate(updates, 1):
-                _log(f"   {i}. {update['range']} = {update['values'][0][0]}")
+                sheets_log.debug("   %s. %s = %s", i, update['range'], update['values'][0][0])
             
             if updates:
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                _log(f"\n🚀 [BATCH_UPDATE_START] {timestamp} - Bắt đầu cập nhật batch với formatting ({len(updates)} ô)...")
+                sheets_log.debug("🚀 [BATCH_UPDATE_START] Bắt đầu cập nhật batch với formatting (%s ô)...", len(updates))
                 
                 # Sử dụng hàm mới kết hợp cập nhật values và formatting trong một lần gọi
                 ok = self.batch_update_values_with_formatting(spreadsheet_id, sheet_name, updates)
                 
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 if ok:
-                    _log(f"\n{'='*80}")
-                    _log(f"✅ [BATCH_UPDATE_SUCCESS] {timestamp} - Cập nhật batch với formatting thành công!")
-                    _log(f"   Số ô đã cập nhật: {len(updates)}")
-                    _log(f"   Font: Google Sans, Cỡ chữ: 9, Căn giữa: CENTER")
-                    _log(f"{'='*80}\n")
+                    sheets_log.info("✅ [BATCH_UPDATE_SUCCESS] Cập nhật batch với formatting thành công!")
+                    sheets_log.debug("   Số ô đã cập nhật: %s", len(updates))
+                    sheets_log.debug("   Font: Google Sans, Cỡ chữ: 9, Căn giữa: CENTER")
                     
-                    # Backup ngay sau khi cập nhật thành công
+                    # Yêu cầu backup sau khi cập nhật thành công (được gom, không chặn)
                     try:
-                        create_backup()
-                        _log("🛡️ Đã tạo backup sau cập nhật timesheet")
+                        request_backup()
+                        sheets_log.debug("🛡️ Đã yêu cầu backup sau cập nhật timesheet")
                     except Exception as e:
-                        _log(f"⚠️ Không thể tạo backup sau cập nhật: {e}")
-                    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                    _log(f"✅ [UPDATE_COMPLETE] {timestamp} - Hoàn thành cập nhật timesheet")
+                        sheets_log.warning("⚠️ Không thể yêu cầu backup sau cập nhật: %s", e)
+                    sheets_log.info("✅ [UPDATE_COMPLETE] Hoàn thành cập nhật timesheet")
                     return True
                 else:
-                    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                    _log(f"\n{'='*80}")
-                    _log(f"❌ [BATCH_UPDATE_FAILED] {timestamp} - CẬP NHẬT BATCH THẤT BẠI!")
-                    _log(f"   Spreadsheet ID: {spreadsheet_id}")
-                    _log(f"   Sheet Name: {sheet_name}")
-                    _log(f"   Số ô cần cập nhật: {len(updates)}")
-                    _log(f"   Row Index: {target_row_index}")
-                    _log(f"{'='*80}\n")
+                    sheets_log.error("❌ [BATCH_UPDATE_FAILED] CẬP NHẬT BATCH THẤT BẠI!")
+                    sheets_log.error("   Spreadsheet ID: %s", spreadsheet_id)
+                    sheets_log.error("   Sheet Name: %s", sheet_name)
+                    sheets_log.error("   Số ô cần cập nhật: %s", len(updates))
+                    sheets_log.error("   Row Index: %s", target_row_index)
                     return False
 
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            print(f"\n{'='*80}")
-            print(f"⚠️ [NO_UPDATES] {timestamp} - KHÔNG CÓ DỮ LIỆU ĐỂ CẬP NHẬT")
-            print(f"   Spreadsheet ID: {spreadsheet_id}")
-            print(f"   Sheet Name: {sheet_name}")
-            print(f"   Row Index: {target_row_index}")
-            print(f"   Attendance Data Keys: {list(attendance_data.keys())}")
-            print(f"   ⚠️ Fallback về cập nhật 1 ô (M35)")
-            print(f"{'='*80}\n")
+            sheets_log.warning("⚠️ [NO_UPDATES] KHÔNG CÓ DỮ LIỆU ĐỂ CẬP NHẬT")
+            sheets_log.warning("   Spreadsheet ID: %s", spreadsheet_id)
+            sheets_log.warning("   Sheet Name: %s", sheet_name)
+            sheets_log.warning("   Row Index: %s", target_row_index)
+            sheets_log.warning("   Attendance Data Keys: %s", list(attendance_data.keys()))
+            sheets_log.warning("   ⚠️ Fallback về cập nhật 1 ô (M35)")
             try:
                 sys.stdout.flush()
             except Exception:
@@ -4389,22 +4194,19 @@ class GoogleDriveAPI:
                 spreadsheet_id, sheet_name, 35, 'M',
                 f"Phê duyệt bởi {attendance_data.get('approved_by','')} - {attendance_data.get('approved_at','')}"
             )
-            print(f"📊 [FALLBACK_UPDATE] Kết quả fallback: {result}")
+            sheets_log.debug("📊 [FALLBACK_UPDATE] Kết quả fallback: %s", result)
             try:
                 sys.stdout.flush()
             except Exception:
                 pass
             return result
         except Exception as e:
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            print(f"\n{'='*80}")
-            print(f"❌ [UPDATE_EXCEPTION] {timestamp} - Lỗi trong update_timesheet_for_attendance")
-            print(f"   Error: {str(e)}")
-            print(f"   Type: {type(e).__name__}")
+            sheets_log.error("❌ [UPDATE_EXCEPTION] Lỗi trong update_timesheet_for_attendance")
+            sheets_log.error("   Error: %s", str(e))
+            sheets_log.error("   Type: %s", type(e).__name__)
             import traceback
-            print(f"   Traceback:")
-            print(traceback.format_exc())
-            print(f"{'='*80}\n")
+            sheets_log.error("   Traceback:")
+            sheets_log.error("%s", traceback.format_exc())
             try:
                 sys.stdout.flush()
             except Exception:
@@ -4428,11 +4230,11 @@ class GoogleDriveAPI:
             
             year_folders = year_results.get('files', [])
             if not year_folders:
-                print(f"❌ Không tìm thấy folder năm {year}")
+                sheets_log.error("❌ Không tìm thấy folder năm %s", year)
                 return None
             
             year_folder = year_folders[0]
-            print(f"✅ Tìm thấy folder năm: {year_folder['name']}")
+            sheets_log.info("✅ Tìm thấy folder năm: %s", year_folder['name'])
             
             # Tìm folder tháng trong folder năm
             month_query = f"'{year_folder['id']}' in parents and trashed=false and name='{month}' and mimeType='application/vnd.google-apps.folder'"
@@ -4444,13 +4246,13 @@ class GoogleDriveAPI:
             
             month_folders = month_results.get('files', [])
             if not month_folders:
-                print(f"❌ Không tìm thấy folder tháng {month}")
+                sheets_log.error("❌ Không tìm thấy folder tháng %s", month)
                 return None
             
             return month_folders[0]
             
         except Exception as e:
-            print(f"❌ Lỗi khi tìm folder tháng: {e}")
+            sheets_log.error("❌ Lỗi khi tìm folder tháng: %s", e)
             return None
     
     def _search_timesheet_in_folder(self, folder_id, target_name, file_name):
@@ -4489,17 +4291,17 @@ class GoogleDriveAPI:
                 
                 files = results.get('files', [])
                 if files:
-                    print(f"✅ Tìm thấy file với tên: {variant}")
+                    sheets_log.info("✅ Tìm thấy file với tên: %s", variant)
                     return files
             
             # Bước 3: Tìm kiếm linh hoạt với từ khóa chính (loại bỏ DMI- để tìm kiếm)
-            print(f"🔄 Thử tìm kiếm linh hoạt với từ khóa...")
+            sheets_log.debug("🔄 Thử tìm kiếm linh hoạt với từ khóa...")
             # Loại bỏ DMI- để tìm kiếm
             base_file_name = file_name.replace('DMI-', '').strip()
             keywords = self._extract_keywords(base_file_name)
             
             for keyword in keywords:
-                print(f"   Tìm kiếm với từ khóa: {keyword}")
+                sheets_log.debug("   Tìm kiếm với từ khóa: %s", keyword)
                 keyword_query = f"'{folder_id}' in parents and trashed=false and name contains '{keyword}'"
                 keyword_results = self.drive_service.files().list(
                     q=keyword_query,
@@ -4515,17 +4317,17 @@ class GoogleDriveAPI:
                         if 'timesheet' in f['name'].lower() or 'sheet' in f['name'].lower()
                     ]
                     if filtered_files:
-                        print(f"✅ Tìm thấy file với từ khóa: {keyword}")
+                        sheets_log.info("✅ Tìm thấy file với từ khóa: %s", keyword)
                         return filtered_files
                     else:
-                        print(f"✅ Tìm thấy file với từ khóa: {keyword} (không có timesheet trong tên)")
+                        sheets_log.info("✅ Tìm thấy file với từ khóa: %s (không có timesheet trong tên)", keyword)
                         return keyword_files
             
-            print(f"❌ Không tìm thấy file nào với tất cả từ khóa")
+            sheets_log.error("❌ Không tìm thấy file nào với tất cả từ khóa")
             return []
             
         except Exception as e:
-            print(f"❌ Lỗi khi tìm kiếm trong folder: {e}")
+            sheets_log.error("❌ Lỗi khi tìm kiếm trong folder: %s", e)
             return []
     
     def find_team_timesheet(self, folder_id, team_name, month_year="202510"):
@@ -4533,7 +4335,7 @@ class GoogleDriveAPI:
         try:
             # Đảm bảo token luôn hợp lệ trước khi sử dụng API
             if not self.ensure_valid_token():
-                print("❌ Không thể đảm bảo token hợp lệ")
+                sheets_log.error("❌ Không thể đảm bảo token hợp lệ")
                 return None
             
             # Lấy tên file từ mapping
@@ -4542,55 +4344,51 @@ class GoogleDriveAPI:
             base_file_name = file_name.replace('DMI-', '').strip() if file_name.startswith('DMI-') else file_name
             target_name = f"{base_file_name}-{month_year}"
             
-            # CHECKS CACHE FIRST
-            cache_key = f"{team_name}_{month_year}"
-            if hasattr(self, '_file_cache') and cache_key in self._file_cache:
-                cached_file = self._file_cache[cache_key]
-                print(f"🚀 [CACHE_HIT] Tìm thấy file trong cache: {cached_file.get('name')} (ID: {cached_file.get('id')})")
+            # CHECKS CACHE FIRST (cache chung cho mọi instance)
+            cached_file = drive_metadata_cache.get_timesheet(team_name, month_year)
+            if cached_file:
+                sheets_log.debug("🚀 [CACHE_HIT] Tìm thấy file trong cache: %s (ID: %s)", cached_file.get('name'), cached_file.get('id'))
                 return cached_file
             
-            print(f"\n🔍 Đang tìm file timesheet của team: {team_name}")
-            print(f"📁 Mapping từ database: {file_name}")
-            print(f"📁 Tên file tìm kiếm: {target_name} (sẽ thử cả DMI-{target_name} nếu cần)")
-            print(f"{'='*60}")
+            sheets_log.debug("🔍 Đang tìm file timesheet của team: %s", team_name)
+            sheets_log.debug("📁 Mapping từ database: %s", file_name)
+            sheets_log.debug("📁 Tên file tìm kiếm: %s (sẽ thử cả DMI-%s nếu cần)", target_name, target_name)
             
             # Bước 1: Tìm trong folder con 2025/10/ trước
-            print(f"🔍 Tìm kiếm trong folder con 2025/10/...")
+            sheets_log.debug("🔍 Tìm kiếm trong folder con 2025/10/...")
             target_folder = self._find_month_folder(folder_id, month_year)
             
             if target_folder:
-                print(f"✅ Tìm thấy folder tháng: {target_folder['name']}")
+                sheets_log.info("✅ Tìm thấy folder tháng: %s", target_folder['name'])
                 files = self._search_timesheet_in_folder(target_folder['id'], target_name, file_name)
                 if files:
                     # Update Cache
-                    if hasattr(self, '_file_cache'):
-                        self._file_cache[cache_key] = files[0]
+                    drive_metadata_cache.set_timesheet(team_name, month_year, files[0])
                     return files[0]  # Trả về file đầu tiên tìm thấy
             else:
-                print(f"❌ Không tìm thấy folder tháng {month_year}")
+                sheets_log.error("❌ Không tìm thấy folder tháng %s", month_year)
             
             # Bước 2: Fallback - tìm trong folder gốc
-            print(f"🔄 Fallback: Tìm trong folder gốc...")
+            sheets_log.debug("🔄 Fallback: Tìm trong folder gốc...")
             files = self._search_timesheet_in_folder(folder_id, target_name, file_name)
             
             if files:
                 # Update Cache
-                if hasattr(self, '_file_cache'):
-                    self._file_cache[cache_key] = files[0]
+                drive_metadata_cache.set_timesheet(team_name, month_year, files[0])
                 return files[0]  # Trả về file đầu tiên tìm thấy
             
-            print(f"❌ Không tìm thấy file timesheet cho team {team_name}")
+            sheets_log.error("❌ Không tìm thấy file timesheet cho team %s", team_name)
             return None
             
         except Exception as e:
-            print(f"❌ Lỗi khi tìm file timesheet: {e}")
+            sheets_log.error("❌ Lỗi khi tìm file timesheet: %s", e)
             return None
     
     def list_all_timesheets(self, folder_id):
         """Lấy danh sách tất cả file timesheet trong folder"""
         try:
             if not self.ensure_valid_token():
-                print("❌ Không thể đảm bảo token hợp lệ")
+                sheets_log.error("❌ Không thể đảm bảo token hợp lệ")
                 return []
             
             query = f"'{folder_id}' in parents and trashed=false and (mimeType='application/vnd.google-apps.spreadsheet' or mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')"
@@ -4604,7 +4402,7 @@ class GoogleDriveAPI:
             return files
             
         except Exception as e:
-            print(f"❌ Lỗi khi lấy danh sách timesheet: {e}")
+            sheets_log.error("❌ Lỗi khi lấy danh sách timesheet: %s", e)
             return []
     
     def _get_file_type(self, mime_type):
@@ -4726,12 +4524,24 @@ class GoogleDriveAPI:
 # ====== BACKUP SCHEDULER ======
 import threading
 import shutil
-import requests
+requests = lazy('requests')
 import time
 
 _backup_scheduler_lock = threading.Lock()
 _backup_scheduler_started = False
 
+# Backup theo yêu cầu: gom (coalesce) nhiều yêu cầu thành tối đa 1 snapshot mỗi cửa sổ
+BACKUP_COALESCE_SECONDS = int(os.environ.get('BACKUP_COALESCE_SECONDS', 300))  # Tối thiểu giữa 2 snapshot
+BACKUP_DEBOUNCE_SECONDS = int(os.environ.get('BACKUP_DEBOUNCE_SECONDS', 15))   # Khoảng yên lặng trước khi chụp
+_backup_request_lock = threading.Lock()
+_backup_request_event = threading.Event()
+_backup_dispatcher_started = False
+_backup_pending_kwargs = None
+_backup_first_request_at = 0.0
+_backup_last_request_at = 0.0
+_backup_last_snapshot_at = 0.0
+_backup_request_stats = {'requested': 0, 'snapshots': 0, 'failed': 0}
+
 # ====== SIMPLE CHATBOT (OLLAMA / DEEPSEEK) ======
 # Cho phép chọn provider bằng biến môi trường:
 # - CHATBOT_PROVIDER=ollama (dùng Ollama local)
@@ -4797,14 +4607,14 @@ def _ensure_ollama_running():
         # Kiểm tra Ollama đã chạy chưa
         if _is_ollama_responding():
             try:
-                print("[CHATBOT] ✅ Ollama đã sẵn sàng")
+                chatbot_log.debug("[CHATBOT] ✅ Ollama đã sẵn sàng")
             except Exception:
                 pass
             return
         
         # Ollama chưa chạy, thử khởi động
         try:
-            print("[CHATBOT] ⚠️  Ollama chưa chạy, đang thử khởi động...")
+            chatbot_log.debug("[CHATBOT] ⚠️  Ollama chưa chạy, đang thử khởi động...")
         except Exception:
             pass
         
@@ -4825,8 +4635,8 @@ def _ensure_ollama_running():
         
         if not ollama_path or not os.path.exists(ollama_path):
             try:
-                print("[CHATBOT] ⚠️  Không tìm thấy lệnh 'ollama'. Vui lòng cài đặt Ollama từ https://ollama.com/download")
-                print("[CHATBOT] 💡 Hoặc chạy 'ollama serve' thủ công trong cửa sổ PowerShell riêng")
+                chatbot_log.debug("[CHATBOT] ⚠️  Không tìm thấy lệnh 'ollama'. Vui lòng cài đặt Ollama từ https://ollama.com/download")
+                chatbot_log.debug("[CHATBOT] 💡 Hoặc chạy 'ollama serve' thủ công trong cửa sổ PowerShell riêng")
             except Exception:
                 pass
             return
@@ -4847,7 +4657,7 @@ def _ensure_ollama_running():
                 creationflags=creation_flags,
             )
             try:
-                print("[CHATBOT] 🔄 Đã khởi động 'ollama serve' trong nền, đang chờ sẵn sàng...")
+                chatbot_log.debug("[CHATBOT] 🔄 Đã khởi động 'ollama serve' trong nền, đang chờ sẵn sàng...")
             except Exception:
                 pass
             
@@ -4856,30 +4666,30 @@ def _ensure_ollama_running():
                 time_module.sleep(1)
                 if _is_ollama_responding():
                     try:
-                        print(f"[CHATBOT] ✅ Ollama đã sẵn sàng sau {i+1} giây")
+                        chatbot_log.debug("[CHATBOT] ✅ Ollama đã sẵn sàng sau %s giây", i + 1)
                     except Exception:
                         pass
                     return
                 if i % 5 == 0 and i > 0:
                     try:
-                        print(f"[CHATBOT] ... vẫn đang chờ Ollama ({i}s)")
+                        chatbot_log.debug("[CHATBOT] ... vẫn đang chờ Ollama (%ss)", i)
                     except Exception:
                         pass
             
             try:
-                print("[CHATBOT] ⚠️  Ollama vẫn chưa sẵn sàng sau 20 giây")
-                print("[CHATBOT] 💡 Vui lòng chạy 'ollama serve' thủ công trong cửa sổ PowerShell riêng")
+                chatbot_log.debug("[CHATBOT] ⚠️  Ollama vẫn chưa sẵn sàng sau 20 giây")
+                chatbot_log.debug("[CHATBOT] 💡 Vui lòng chạy 'ollama serve' thủ công trong cửa sổ PowerShell riêng")
             except Exception:
                 pass
         except Exception as e:
             try:
-                print(f"[CHATBOT] ❌ Không thể khởi động 'ollama serve': {e}")
-                print("[CHATBOT] 💡 Vui lòng chạy 'ollama serve' thủ công trong cửa sổ PowerShell riêng")
+                chatbot_log.debug("[CHATBOT] ❌ Không thể khởi động 'ollama serve': %s", e)
+                chatbot_log.debug("[CHATBOT] 💡 Vui lòng chạy 'ollama serve' thủ công trong cửa sổ PowerShell riêng")
             except Exception:
                 pass
     except Exception as e:
         try:
-            print(f"[CHATBOT] ⚠️  Lỗi khi kiểm tra/khởi động Ollama: {e}")
+            chatbot_log.debug("[CHATBOT] ⚠️  Lỗi khi kiểm tra/khởi động Ollama: %s", e)
         except Exception:
             pass
 
@@ -6602,12 +6412,12 @@ def _run_chatbot_index_now():
 
             kb.main()
             try:
-                print("[CHATBOT] Đã index knowledge store.")
+                chatbot_log.debug("[CHATBOT] Đã index knowledge store.")
             except Exception:
                 pass
         except Exception as e:
             try:
-                print(f"[CHATBOT] Không thể index tự động: {e}")
+                chatbot_log.debug("[CHATBOT] Không thể index tự động: %s", e)
             except Exception:
                 pass
 
@@ -6670,7 +6480,7 @@ def _retrieve_chatbot_context(question: str, top_k: int = CHATBOT_TOP_K, max_cha
         q_emb = embedder.encode([question], normalize_embeddings=True).tolist()[0]
     except Exception as e:
         try:
-            print(f"[CHATBOT] Lỗi encode câu hỏi: {e}")
+            chatbot_log.debug("[CHATBOT] Lỗi encode câu hỏi: %s", e)
         except Exception:
             pass
         return ""
@@ -6683,7 +6493,7 @@ def _retrieve_chatbot_context(question: str, top_k: int = CHATBOT_TOP_K, max_cha
         )
     except Exception as e:
         try:
-            print(f"[CHATBOT] Lỗi truy vấn knowledge store: {e}")
+            chatbot_log.debug("[CHATBOT] Lỗi truy vấn knowledge store: %s", e)
         except Exception:
             pass
         return ""
@@ -6908,7 +6718,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
         with _chatbot_cache_lock:
             if cache_key in _chatbot_cache:
                 try:
-                    print(f"[CHATBOT] Cache hit - trả lời ngay lập tức")
+                    chatbot_log.debug("[CHATBOT] Cache hit - trả lời ngay lập tức")
                 except Exception:
                     pass
                 return _chatbot_cache[cache_key]
@@ -7055,7 +6865,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
                 
         except Exception as e:
             try:
-                print(f"[CHATBOT] Lỗi xử lý UI context: {e}")
+                chatbot_log.debug("[CHATBOT] Lỗi xử lý UI context: %s", e)
             except Exception:
                 pass
 
@@ -7093,7 +6903,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
         else:
             # Timeout - bỏ qua RAG để trả lời nhanh hơn
             try:
-                print(f"[CHATBOT] RAG timeout - bỏ qua để trả lời nhanh hơn")
+                chatbot_log.debug("[CHATBOT] RAG timeout - bỏ qua để trả lời nhanh hơn")
             except Exception:
                 pass
         
@@ -7101,15 +6911,15 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
             system_prompt += "\n" + rag_context
     except Exception as e:
         try:
-            print(f"[CHATBOT] Lỗi RAG: {e}")
+            chatbot_log.debug("[CHATBOT] Lỗi RAG: %s", e)
         except Exception:
             pass
 
     # Ưu tiên DeepSeek nếu được cấu hình đầy đủ
     provider = CHATBOT_PROVIDER
     try:
-        print(f"[CHATBOT] Provider={provider}, model_ollama={OLLAMA_MODEL}, model_deepseek={DEEPSEEK_MODEL}")
-        print(f"[CHATBOT] User message: {user_message[:200]}{'...' if len(user_message) > 200 else ''}")
+        chatbot_log.debug("[CHATBOT] Provider=%s, model_ollama=%s, model_deepseek=%s", provider, OLLAMA_MODEL, DEEPSEEK_MODEL)
+        chatbot_log.debug("[CHATBOT] User message: %s%s", user_message[:200], ('...' if len(user_message) > 200 else ''))
     except Exception:
         pass
     if provider == 'deepseek' and DEEPSEEK_API_KEY:
@@ -7154,7 +6964,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
                         .strip()
                     or "Xin lỗi, mình chưa nhận được nội dung trả lời từ DeepSeek.")
             try:
-                print(f"[CHATBOT] DeepSeek answer length: {len(answer)}")
+                chatbot_log.debug("[CHATBOT] DeepSeek answer length: %s", len(answer))
             except Exception:
                 pass
             answer = _sanitize_chatbot_output(answer) or _CHATBOT_CLARIFY_MESSAGE
@@ -7166,7 +6976,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
                 _chatbot_cache[cache_key] = answer
             return answer
         except Exception as e:
-            print(f"[CHATBOT] Lỗi gọi DeepSeek: {e}")
+            chatbot_log.debug("[CHATBOT] Lỗi gọi DeepSeek: %s", e)
             # Fallback sang Ollama nếu có
             provider = 'ollama'
 
@@ -7176,7 +6986,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
         try:
             health_check = requests.get(OLLAMA_API_URL.replace('/api/chat', '/api/tags'), timeout=3)
             if health_check.status_code != 200:
-                print(f"[CHATBOT] Ollama service trả về status code: {health_check.status_code}")
+                chatbot_log.debug("[CHATBOT] Ollama service trả về status code: %s", health_check.status_code)
                 raise Exception(f"Ollama service không phản hồi (status: {health_check.status_code})")
             
             # Kiểm tra model có sẵn không
@@ -7185,28 +6995,28 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
                 available_models = [model.get('name', '').split(':')[0] for model in tags_data.get('models', [])]
                 model_name = OLLAMA_MODEL.split(':')[0]
                 if model_name not in available_models:
-                    print(f"[CHATBOT] Model '{OLLAMA_MODEL}' chưa được tải. Models có sẵn: {available_models}")
-                    print(f"[CHATBOT] Vui lòng chạy: ollama pull {OLLAMA_MODEL}")
+                    chatbot_log.debug("[CHATBOT] Model '%s' chưa được tải. Models có sẵn: %s", OLLAMA_MODEL, available_models)
+                    chatbot_log.debug("[CHATBOT] Vui lòng chạy: ollama pull %s", OLLAMA_MODEL)
                     # Vẫn thử gọi, có thể model đang được pull tự động
             except Exception as model_check_err:
-                print(f"[CHATBOT] Không thể kiểm tra model: {model_check_err}")
+                chatbot_log.debug("[CHATBOT] Không thể kiểm tra model: %s", model_check_err)
                 
         except requests.exceptions.ConnectionError as conn_err:
-            print(f"[CHATBOT] ❌ Không thể kết nối đến Ollama tại {OLLAMA_API_URL.replace('/api/chat', '')}")
-            print(f"[CHATBOT] Lỗi chi tiết: {conn_err}")
-            print(f"[CHATBOT] 💡 Giải pháp: Đảm bảo Ollama đang chạy bằng lệnh 'ollama serve'")
-            print(f"[CHATBOT] ⚠️  Sử dụng fallback answer với hướng dẫn chi tiết từ system prompt")
+            chatbot_log.debug("[CHATBOT] ❌ Không thể kết nối đến Ollama tại %s", OLLAMA_API_URL.replace('/api/chat', ''))
+            chatbot_log.debug("[CHATBOT] Lỗi chi tiết: %s", conn_err)
+            chatbot_log.debug("[CHATBOT] 💡 Giải pháp: Đảm bảo Ollama đang chạy bằng lệnh 'ollama serve'")
+            chatbot_log.debug("[CHATBOT] ⚠️  Sử dụng fallback answer với hướng dẫn chi tiết từ system prompt")
             fallback_answer = _get_fallback_answer(user_message)
             return fallback_answer
         except requests.exceptions.Timeout as timeout_err:
-            print(f"[CHATBOT] ❌ Timeout khi kiểm tra Ollama (quá 3 giây)")
-            print(f"[CHATBOT] 💡 Giải pháp: Kiểm tra Ollama có đang chạy không")
-            print(f"[CHATBOT] ⚠️  Sử dụng fallback answer với hướng dẫn chi tiết từ system prompt")
+            chatbot_log.debug("[CHATBOT] ❌ Timeout khi kiểm tra Ollama (quá 3 giây)")
+            chatbot_log.debug("[CHATBOT] 💡 Giải pháp: Kiểm tra Ollama có đang chạy không")
+            chatbot_log.debug("[CHATBOT] ⚠️  Sử dụng fallback answer với hướng dẫn chi tiết từ system prompt")
             fallback_answer = _get_fallback_answer(user_message)
             return fallback_answer
         except Exception as conn_err:
-            print(f"[CHATBOT] ❌ Ollama không khả dụng: {conn_err}")
-            print(f"[CHATBOT] ⚠️  Sử dụng fallback answer với hướng dẫn chi tiết từ system prompt")
+            chatbot_log.debug("[CHATBOT] ❌ Ollama không khả dụng: %s", conn_err)
+            chatbot_log.debug("[CHATBOT] ⚠️  Sử dụng fallback answer với hướng dẫn chi tiết từ system prompt")
             fallback_answer = _get_fallback_answer(user_message)
             return fallback_answer
         
@@ -7238,7 +7048,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
         }
         
         try:
-            print(f"[CHATBOT] Đang gọi Ollama API với model: {OLLAMA_MODEL}")
+            chatbot_log.debug("[CHATBOT] Đang gọi Ollama API với model: %s", OLLAMA_MODEL)
             # Timeout: 5s cho kết nối, 120s cho đọc response (model có thể cần thời gian để tải/generate)
             resp = requests.post(OLLAMA_API_URL, json=payload, timeout=(5, 120))
             resp.raise_for_status()
@@ -7248,7 +7058,7 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
             content = (message.get("content") or "").strip()
             if content:
                 try:
-                    print(f"[CHATBOT] ✅ Ollama trả lời thành công, độ dài: {len(content)} ký tự")
+                    chatbot_log.debug("[CHATBOT] ✅ Ollama trả lời thành công, độ dài: %s ký tự", len(content))
                 except Exception:
                     pass
                 content = _sanitize_chatbot_output(content) or _CHATBOT_CLARIFY_MESSAGE
@@ -7260,33 +7070,33 @@ def call_chatbot_llm(user_message: str, user_context: dict | None = None, conver
                     _chatbot_cache[cache_key] = content
                 return content
             else:
-                print(f"[CHATBOT] ⚠️ Ollama trả về response nhưng không có nội dung. Response: {data}")
+                chatbot_log.debug("[CHATBOT] ⚠️ Ollama trả về response nhưng không có nội dung. Response: %s", data)
                 error_msg = "Xin lỗi, mình chưa nhận được nội dung trả lời từ mô hình AI (Ollama)."
                 return error_msg
         except requests.exceptions.HTTPError as http_err:
-            print(f"[CHATBOT] ❌ Lỗi HTTP từ Ollama: {http_err}")
+            chatbot_log.debug("[CHATBOT] ❌ Lỗi HTTP từ Ollama: %s", http_err)
             if hasattr(http_err.response, 'text'):
-                print(f"[CHATBOT] Response body: {http_err.response.text[:500]}")
+                chatbot_log.debug("[CHATBOT] Response body: %s", http_err.response.text[:500])
             # Có thể là model chưa được pull
             if http_err.response.status_code == 404:
-                print(f"[CHATBOT] 💡 Model '{OLLAMA_MODEL}' có thể chưa được tải. Chạy: ollama pull {OLLAMA_MODEL}")
+                chatbot_log.debug("[CHATBOT] 💡 Model '%s' có thể chưa được tải. Chạy: ollama pull %s", OLLAMA_MODEL, OLLAMA_MODEL)
             fallback_answer = _get_fallback_answer(user_message)
             return fallback_answer
             
     except requests.exceptions.ConnectionError as conn_err:
-        print(f"[CHATBOT] ❌ Lỗi kết nối Ollama khi gọi API: {conn_err}")
-        print(f"[CHATBOT] URL: {OLLAMA_API_URL}")
+        chatbot_log.debug("[CHATBOT] ❌ Lỗi kết nối Ollama khi gọi API: %s", conn_err)
+        chatbot_log.debug("[CHATBOT] URL: %s", OLLAMA_API_URL)
         fallback_answer = _get_fallback_answer(user_message)
         return fallback_answer
     except requests.exceptions.Timeout as timeout_err:
-        print(f"[CHATBOT] ❌ Ollama timeout sau 120 giây: {timeout_err}")
-        print(f"[CHATBOT] 💡 Model có thể đang được tải lần đầu hoặc cần thời gian xử lý dài, vui lòng thử lại sau")
+        chatbot_log.debug("[CHATBOT] ❌ Ollama timeout sau 120 giây: %s", timeout_err)
+        chatbot_log.debug("[CHATBOT] 💡 Model có thể đang được tải lần đầu hoặc cần thời gian xử lý dài, vui lòng thử lại sau")
         fallback_answer = _get_fallback_answer(user_message)
         return fallback_answer
     except Exception as e:
-        print(f"[CHATBOT] ❌ Lỗi không xác định khi gọi Ollama: {type(e).__name__}: {e}")
+        chatbot_log.debug("[CHATBOT] ❌ Lỗi không xác định khi gọi Ollama: %s: %s", type(e).__name__, e)
         import traceback
-        print(f"[CHATBOT] Traceback: {traceback.format_exc()}")
+        chatbot_log.error("[CHATBOT] Traceback: %s", traceback.format_exc())
         fallback_answer = _get_fallback_answer(user_message)
         return fallback_answer
 
@@ -7324,9 +7134,9 @@ def _license_check_worker(interval_seconds: int = 60):
     from datetime import datetime
 
     # Đợi vài giây cho app & database khởi động xong
-    print(f"[LICENSE] License checker worker đang khởi động, sẽ bắt đầu kiểm tra sau 5 giây...", flush=True)
+    license_log.debug("[LICENSE] License checker worker đang khởi động, sẽ bắt đầu kiểm tra sau 5 giây...")
     time.sleep(5)
-    print(f"[LICENSE] Bắt đầu kiểm tra license định kỳ (mỗi {interval_seconds} giây)...", flush=True)
+    license_log.debug("[LICENSE] Bắt đầu kiểm tra license định kỳ (mỗi %s giây)...", interval_seconds)
     
     # Interval động: bắt đầu với interval_seconds, sẽ tự điều chỉnh dựa trên days_remaining
     current_interval = interval_seconds
@@ -7334,11 +7144,13 @@ def _license_check_worker(interval_seconds: int = 60):
     while True:
         try:
             with app.app_context():
+                # Làm mới trạng thái kích hoạt mỗi vòng (đồng bộ thay đổi từ worker khác / script ngoài)
+                activation_state.refresh(_load_activation_snapshot, reason='license_worker')
                 # Sử dụng hàm helper để lấy license key nhất quán
                 license_key = get_license_key()
 
                 if not license_key:
-                    print("[LICENSE] Không tìm thấy license key để verify. Đã chặn truy cập app.")
+                    license_log.debug("[LICENSE] Không tìm thấy license key để verify. Đã chặn truy cập app.")
                     global _license_is_valid
                     _license_is_valid = False
                     time.sleep(current_interval)
@@ -7354,9 +7166,9 @@ def _license_check_worker(interval_seconds: int = 60):
                         from datetime import datetime, timedelta
                         next_check_time = datetime.now() + timedelta(seconds=current_interval)
                         next_check_str = next_check_time.strftime("%H:%M:%S")
-                        print(f"[LICENSE] Lỗi kết nối server license: {e}. Sẽ thử lại sau {current_interval} giây (lần tiếp theo: {next_check_str})", flush=True)
+                        license_log.debug("[LICENSE] Lỗi kết nối server license: %s. Sẽ thử lại sau %s giây (lần tiếp theo: %s)", e, current_interval, next_check_str)
                     except Exception:
-                        print(f"[LICENSE] Lỗi kết nối server license: {e}. Sẽ thử lại sau {current_interval} giây.", flush=True)
+                        license_log.debug("[LICENSE] Lỗi kết nối server license: %s. Sẽ thử lại sau %s giây.", e, current_interval)
                     time.sleep(current_interval)
                     continue
 
@@ -7365,9 +7177,9 @@ def _license_check_worker(interval_seconds: int = 60):
                         from datetime import datetime, timedelta
                         next_check_time = datetime.now() + timedelta(seconds=current_interval)
                         next_check_str = next_check_time.strftime("%H:%M:%S")
-                        print(f"[LICENSE] Server license trả về status {resp.status_code}. Sẽ thử lại sau {current_interval} giây (lần tiếp theo: {next_check_str})", flush=True)
+                        license_log.debug("[LICENSE] Server license trả về status %s. Sẽ thử lại sau %s giây (lần tiếp theo: %s)", resp.status_code, current_interval, next_check_str)
                     except Exception:
-                        print(f"[LICENSE] Server license trả về status {resp.status_code}. Sẽ thử lại sau {current_interval} giây.", flush=True)
+                        license_log.debug("[LICENSE] Server license trả về status %s. Sẽ thử lại sau %s giây.", resp.status_code, current_interval)
                     time.sleep(current_interval)
                     continue
 
@@ -7376,7 +7188,7 @@ def _license_check_worker(interval_seconds: int = 60):
                 except Exception as e:
                     # Server license không trả về JSON chuẩn (thường là HTML hiển thị thông tin license).
                     # Thay vì dừng app ngay, ta cố gắng phân tích nội dung text để suy ra trạng thái license.
-                    print(f"[LICENSE] Không parse được JSON từ server license: {e}. Thử phân tích nội dung text...")
+                    license_log.debug("[LICENSE] Không parse được JSON từ server license: %s. Thử phân tích nội dung text...", e)
                     data = _infer_license_data_from_text(resp.text or "", license_key=license_key)
                     if not data:
                         # Không đoán được trạng thái từ nội dung -> log lại và tạm cho qua để không khóa app nhầm.
@@ -7384,9 +7196,9 @@ def _license_check_worker(interval_seconds: int = 60):
                             from datetime import datetime, timedelta
                             next_check_time = datetime.now() + timedelta(seconds=current_interval)
                             next_check_str = next_check_time.strftime("%H:%M:%S")
-                            print(f"[LICENSE] Không xác định được trạng thái license từ nội dung server. Sẽ thử lại sau {current_interval} giây (lần tiếp theo: {next_check_str})", flush=True)
+                            license_log.debug("[LICENSE] Không xác định được trạng thái license từ nội dung server. Sẽ thử lại sau %s giây (lần tiếp theo: %s)", current_interval, next_check_str)
                         except Exception:
-                            print(f"[LICENSE] Không xác định được trạng thái license từ nội dung server. Sẽ thử lại sau {current_interval} giây.", flush=True)
+                            license_log.debug("[LICENSE] Không xác định được trạng thái license từ nội dung server. Sẽ thử lại sau %s giây.", current_interval)
                         time.sleep(current_interval)
                         continue
 
@@ -7427,11 +7239,11 @@ def _license_check_worker(interval_seconds: int = 60):
                         days_remaining = calculated_days_remaining
                         if calculated_days_remaining < 0:
                             expired = True
-                            print(f"[LICENSE] Đã tính lại days_remaining từ expiry: {calculated_days_remaining} ngày (ĐÃ HẾT HẠN) (từ API: {data.get('days_remaining', 'N/A')})")
+                            license_log.debug("[LICENSE] Đã tính lại days_remaining từ expiry: %s ngày (ĐÃ HẾT HẠN) (từ API: %s)", calculated_days_remaining, data.get('days_remaining', 'N/A'))
                         else:
-                            print(f"[LICENSE] Đã tính lại days_remaining từ expiry: {calculated_days_remaining} ngày (từ API: {data.get('days_remaining', 'N/A')})")
+                            license_log.debug("[LICENSE] Đã tính lại days_remaining từ expiry: %s ngày (từ API: %s)", calculated_days_remaining, data.get('days_remaining', 'N/A'))
                     except Exception as e:
-                        print(f"[LICENSE] Lỗi parse expiry '{expiry_str}': {e}")
+                        license_log.debug("[LICENSE] Lỗi parse expiry '%s': %s", expiry_str, e)
 
                 # 1) Nếu có days_remaining - điều chỉnh interval động dựa trên trạng thái license
                 if isinstance(days_remaining, (int, float)):
@@ -7439,12 +7251,12 @@ def _license_check_worker(interval_seconds: int = 60):
                     if 0 <= days_remaining <= 7:
                         if current_interval > 30:
                             current_interval = 30
-                            print(f"[LICENSE] License sắp hết hạn ({days_remaining} ngày), giảm interval xuống 30 giây để check thường xuyên hơn", flush=True)
+                            license_log.debug("[LICENSE] License sắp hết hạn (%s ngày), giảm interval xuống 30 giây để check thường xuyên hơn", days_remaining)
                     else:
                         # License còn nhiều thời gian, dùng interval mặc định
                         if current_interval != interval_seconds:
                             current_interval = interval_seconds
-                            print(f"[LICENSE] License còn nhiều thời gian, tăng interval về {interval_seconds} giây", flush=True)
+                            license_log.debug("[LICENSE] License còn nhiều thời gian, tăng interval về %s giây", interval_seconds)
                     
                     # Nếu còn ≤ 1 ngày nhưng CHƯA hết hạn -> gửi cảnh báo cho toàn hệ thống (giống cơ chế refresh token)
                     # Áp dụng cho cả trường hợp days_remaining == 1 và days_remaining == 0 nhưng vẫn còn giờ/phút/giây.
@@ -7503,10 +7315,10 @@ def _license_check_worker(interval_seconds: int = 60):
                     )
                     # In rõ license key đang sử dụng để dễ debug khi hết hạn/không hợp lệ
                     try:
-                        print(f"[LICENSE] License key đang dùng: {license_key}")
+                        license_log.debug("[LICENSE] License key đang dùng: %s", license_key)
                     except Exception:
                         pass
-                    print(f"[LICENSE] License KHÔNG HỢP LỆ / HẾT HẠN - Đã chặn truy cập app: {contact_msg}")
+                    license_log.debug("[LICENSE] License KHÔNG HỢP LỆ / HẾT HẠN - Đã chặn truy cập app: %s", contact_msg)
                     try:
                         # Thử gửi thông báo qua Telegram nếu đã cấu hình
                         send_telegram_message(f"[LICENSE EXPIRED]\n{contact_msg}")
@@ -7516,7 +7328,7 @@ def _license_check_worker(interval_seconds: int = 60):
                 else:
                     # License hợp lệ -> cho phép truy cập
                     if not _license_is_valid:
-                        print(f"[LICENSE] License đã được gia hạn - Cho phép truy cập lại app")
+                        license_log.debug("[LICENSE] License đã được gia hạn - Cho phép truy cập lại app")
                     _license_is_valid = True
 
                     # Nếu trước đó có cảnh báo LICENSE, clear cache để UI ẩn banner ở lần load sau
@@ -7533,21 +7345,21 @@ def _license_check_worker(interval_seconds: int = 60):
                 # Nếu tới đây là license vẫn hợp lệ
                 try:
                     exp_info = expiry_str or "N/A"
-                    print(f"[LICENSE] License hợp lệ. Hết hạn: {exp_info}, days_remaining={days_remaining}")
+                    license_log.debug("[LICENSE] License hợp lệ. Hết hạn: %s, days_remaining=%s", exp_info, days_remaining)
                 except Exception:
                     pass
 
         except Exception as e:
-            print(f"[LICENSE] Lỗi không mong đợi trong license_check_worker: {e}")
+            license_log.debug("[LICENSE] Lỗi không mong đợi trong license_check_worker: %s", e)
 
         # Log thông tin về lần check tiếp theo
         try:
             from datetime import datetime, timedelta
             next_check_time = datetime.now() + timedelta(seconds=current_interval)
             next_check_str = next_check_time.strftime("%H:%M:%S")
-            print(f"[LICENSE] Sẽ kiểm tra lại sau {current_interval} giây (lần tiếp theo: {next_check_str})", flush=True)
+            license_log.debug("[LICENSE] Sẽ kiểm tra lại sau %s giây (lần tiếp theo: %s)", current_interval, next_check_str)
         except Exception:
-            print(f"[LICENSE] Sẽ kiểm tra lại sau {current_interval} giây", flush=True)
+            license_log.debug("[LICENSE] Sẽ kiểm tra lại sau %s giây", current_interval)
 
         # Ngủ trước khi kiểm tra lại (dùng current_interval động)
         time.sleep(current_interval)
@@ -7564,43 +7376,43 @@ def _check_license_once() -> tuple[bool, bool, str, str]:
     with app.app_context():
         # Sử dụng hàm helper để lấy license key nhất quán
         license_key = get_license_key()
-        print(f"[LICENSE] License key đang dùng: {license_key}", flush=True)
+        license_log.debug("[LICENSE] License key đang dùng: %s", license_key)
 
         if not license_key:
             msg = "Không có license key"
-            print(f"[LICENSE] {msg}")
+            license_log.debug("[LICENSE] %s", msg)
             return False, True, "missing", msg
 
         # Ưu tiên dùng API endpoint, fallback về ?verify= nếu API không có
         verify_url = f"{LICENSE_VERIFY_ENDPOINT.rstrip('/')}/api/verify?verify={license_key}"
-        print(f"[LICENSE] Calling API: {verify_url}", flush=True)
+        license_log.debug("[LICENSE] Calling API: %s", verify_url)
         try:
             resp = requests.get(verify_url, timeout=10)
-            print(f"[LICENSE] API Status Code: {resp.status_code}", flush=True)
+            license_log.debug("[LICENSE] API Status Code: %s", resp.status_code)
         except Exception as e:
             msg = f"Lỗi kết nối server license: {e}"
-            print(f"[LICENSE] {msg}")
+            license_log.debug("[LICENSE] %s", msg)
             # Lỗi mạng: coi như chưa xác định, nhưng không đánh expired, để caller quyết định
             return True, False, "unknown", msg
 
         if resp.status_code != 200:
             msg = f"Server license trả về status {resp.status_code}"
-            print(f"[LICENSE] {msg}")
+            license_log.debug("[LICENSE] %s", msg)
             return True, False, "unknown", msg
 
         # Parse JSON hoặc text như trong worker
         try:
             data = resp.json()
             # Debug: log full response để kiểm tra
-            print(f"[LICENSE] API Response Full: {resp.text[:500]}", flush=True)
-            print(f"[LICENSE] API Response Parsed: valid={data.get('valid')}, status={data.get('status')}, message={data.get('message')}, key={data.get('key')}", flush=True)
+            license_log.debug("[LICENSE] API Response Full: %s", resp.text[:500])
+            license_log.debug("[LICENSE] API Response Parsed: valid=%s, status=%s, message=%s, key=%s", data.get('valid'), data.get('status'), data.get('message'), data.get('key'))
         except Exception as e:
-            print(f"[LICENSE] Không parse được JSON từ server license: {e}. Thử phân tích nội dung text...")
-            print(f"[LICENSE] Response text: {resp.text[:200]}", flush=True)
+            license_log.debug("[LICENSE] Không parse được JSON từ server license: %s. Thử phân tích nội dung text...", e)
+            license_log.debug("[LICENSE] Response text: %s", resp.text[:200])
             data = _infer_license_data_from_text(resp.text or "", license_key=license_key)
             if not data:
                 msg = "Không xác định được trạng thái license từ nội dung server."
-                print(f"[LICENSE] {msg}")
+                license_log.debug("[LICENSE] %s", msg)
                 return True, False, "unknown", msg
 
         is_valid = bool(data.get("valid", False))
@@ -7620,11 +7432,11 @@ def _check_license_once() -> tuple[bool, bool, str, str]:
                 if expiry_dt < now_dt:
                     expired = True
             except Exception as e:
-                print(f"[LICENSE] Lỗi parse expiry '{expiry_str}': {e}")
+                license_log.debug("[LICENSE] Lỗi parse expiry '%s': %s", expiry_str, e)
 
         msg = data.get("message", "")
         # Debug: log kết quả cuối cùng
-        print(f"[LICENSE] Check result: is_valid={is_valid}, expired={expired}, status={status}, msg={msg}", flush=True)
+        license_log.debug("[LICENSE] Check result: is_valid=%s, expired=%s, status=%s, msg=%s", is_valid, expired, status, msg)
         return is_valid, expired, status, msg
 
 def ensure_license_check_started(interval_seconds: int = 60):
@@ -7645,9 +7457,9 @@ def ensure_license_check_started(interval_seconds: int = 60):
             )
             t.start()
             _license_check_started = True
-            print(f"[LICENSE] License online checker started (mỗi {interval_seconds} giây).")
+            license_log.debug("[LICENSE] License online checker started (mỗi %s giây).", interval_seconds)
         except Exception as e:
-            print(f"[LICENSE] Không thể khởi động license online checker: {e}")
+            license_log.debug("[LICENSE] Không thể khởi động license online checker: %s", e)
 
 # Telegram Bot Configuration (load from environment variables)
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
@@ -7699,6 +7511,13 @@ def send_telegram_file(file_path, caption=None):
         print(f"❌ Lỗi khi gửi file lên Telegram: {e}")
         return False
 
+def _snapshot_sqlite_database(src, dst, pages_per_step=1024):
+    """
+    Chụp snapshot nhất quán của SQLite bằng online backup API (sqlite3.Connection.backup).
+    Không bao giờ sao chép file giữa chừng một lần ghi; ghi ra file tạm rồi đổi tên.
+    """
+    backup_sqlite_database(src, dst, pages_per_step=pages_per_step)
+
 def create_backup(backup_dir="backups", retention=3, send_to_telegram=True):
     """
     Sao lưu database: ưu tiên instance/attendance.db; fallback attendance.db tại root.
@@ -7722,7 +7541,7 @@ def create_backup(backup_dir="backups", retention=3, send_to_telegram=True):
             return False
         base_name = f"attendance_{timestamp}.db"
         dst = os.path.join(backup_dir, base_name)
-        shutil.copy2(src, dst)
+        _snapshot_sqlite_database(src, dst)
         print(f"✅ Đã backup database: {dst}")
         
         # Gửi lên Telegram nếu được yêu cầu
@@ -7747,6 +7566,86 @@ def create_backup(backup_dir="backups", retention=3, send_to_telegram=True):
         print(f"❌ Lỗi khi backup database: {e}")
         return False
 
+def request_backup(reason="", backup_dir="backups", retention=3, send_to_telegram=True):
+    """
+    Yêu cầu backup KHÔNG chặn: chỉ đánh dấu và trả về ngay.
+    Các yêu cầu liên tiếp được gom lại; thread nền chụp tối đa 1 snapshot
+    mỗi BACKUP_COALESCE_SECONDS (sau khoảng yên lặng BACKUP_DEBOUNCE_SECONDS).
+    """
+    global _backup_pending_kwargs, _backup_first_request_at, _backup_last_request_at
+    now = time_module.time()
+    with _backup_request_lock:
+        if _backup_pending_kwargs is None:
+            _backup_first_request_at = now
+        _backup_last_request_at = now
+        _backup_pending_kwargs = {
+            'backup_dir': backup_dir,
+            'retention': retention,
+            'send_to_telegram': send_to_telegram,
+        }
+        _backup_request_stats['requested'] += 1
+        _backup_request_event.set()
+    if reason:
+        print(f"🛡️ [BACKUP_REQUEST] Đã ghi nhận yêu cầu backup ({reason})")
+    _ensure_backup_dispatcher_started()
+
+def get_backup_request_stats():
+    """Thống kê số yêu cầu backup / số snapshot thực sự đã chụp / số lần chụp lỗi"""
+    with _backup_request_lock:
+        return dict(_backup_request_stats,
+                    pending=_backup_pending_kwargs is not None,
+                    last_snapshot_at=_backup_last_snapshot_at or None)
+
+def _backup_dispatcher_worker():
+    """Thread nền duy nhất thực hiện các yêu cầu backup đã được gom."""
+    global _backup_pending_kwargs, _backup_last_snapshot_at
+    while True:
+        _backup_request_event.wait()
+        try:
+            # Debounce: đợi khoảng yên lặng để gom thêm yêu cầu (không quá 1 cửa sổ coalesce)
+            while True:
+                time_module.sleep(max(1, BACKUP_DEBOUNCE_SECONDS))
+                now = time_module.time()
+                with _backup_request_lock:
+                    quiet = now - _backup_last_request_at >= BACKUP_DEBOUNCE_SECONDS
+                    waited_too_long = now - _backup_first_request_at >= BACKUP_COALESCE_SECONDS
+                if quiet or waited_too_long:
+                    break
+
+            # Tối đa 1 snapshot mỗi cửa sổ
+            wait_seconds = _backup_last_snapshot_at + BACKUP_COALESCE_SECONDS - time_module.time()
+            if wait_seconds > 0:
+                time_module.sleep(wait_seconds)
+
+            with _backup_request_lock:
+                kwargs = _backup_pending_kwargs
+                _backup_pending_kwargs = None
+                _backup_request_event.clear()
+            if kwargs is None:
+                continue
+
+            created = create_backup(**kwargs)
+            with _backup_request_lock:
+                # Lần thử lỗi vẫn tính vào nhịp coalesce (không thử lại dồn dập), nhưng không đếm là snapshot
+                _backup_last_snapshot_at = time_module.time()
+                _backup_request_stats['snapshots' if created else 'failed'] += 1
+        except Exception as e:
+            print(f"⚠️ Lỗi trong backup dispatcher: {e}")
+            time_module.sleep(5)
+
+def _ensure_backup_dispatcher_started():
+    global _backup_dispatcher_started
+    if _backup_dispatcher_started:
+        return
+    with _backup_scheduler_lock:
+        if _backup_dispatcher_started:
+            return
+        try:
+            threading.Thread(target=_backup_dispatcher_worker, name='backup-dispatcher', daemon=True).start()
+            _backup_dispatcher_started = True
+        except Exception as e:
+            print(f"⚠️ Không thể khởi chạy backup dispatcher: {e}")
+
 def _backup_worker(interval_minutes=180, backup_dir="backups", retention=3, send_to_telegram=True):
     """Worker chạy nền để backup định kỳ."""
     # Đợi interval đầu tiên trước khi chạy backup lần đầu (tránh tạo backup ngay khi khởi động)
@@ -7763,9 +7662,9 @@ def _backup_worker(interval_minutes=180, backup_dir="backups", retention=3, send
             # Fallback ngủ 3 giờ nếu cấu hình lỗi
             time_module.sleep(3 * 60 * 60)
         
-        # Sau khi ngủ xong, mới chạy backup
+        # Sau khi ngủ xong, gửi yêu cầu backup (được gom chung với các yêu cầu từ Google Sheet)
         try:
-            create_backup(backup_dir=backup_dir, retention=retention, send_to_telegram=send_to_telegram)
+            request_backup(reason="periodic", backup_dir=backup_dir, retention=retention, send_to_telegram=send_to_telegram)
         except Exception as e:
             print(f"⚠️ Lỗi trong backup worker: {e}")
 
@@ -7808,7 +7707,7 @@ def _token_keepalive_worker(interval_minutes=30):
             
             # Nếu không có token hoặc token không hợp lệ, chỉ thông báo, không authenticate
             if not google_api.creds:
-                print(f"⚠️ [Token Keep-Alive] Không có token. Cần admin bấm nút Refresh Token để ủy quyền.")
+                sheets_log.warning("⚠️ [Token Keep-Alive] Không có token. Cần admin bấm nút Refresh Token để ủy quyền.")
                 try:
                     publish_token_status('expired', 'Không có token. Vui lòng bấm nút Refresh Token để ủy quyền.', needs_reauth=True)
                 except Exception:
@@ -7820,13 +7719,13 @@ def _token_keepalive_worker(interval_minutes=30):
             if google_api.creds.expired:
                 if google_api.creds.refresh_token:
                     try:
-                        print(f"🔄 [Token Keep-Alive] Đang refresh token tự động...")
+                        sheets_log.debug("🔄 [Token Keep-Alive] Đang refresh token tự động...")
                         google_api.creds.refresh(GoogleRequest())
                         # Lưu token mới
                         with open(google_api.token_file, 'w') as token:
                             token.write(google_api.creds.to_json())
                         google_api.save_last_refresh_time()
-                        print(f"✅ [Token Keep-Alive] Token đã được refresh thành công!")
+                        sheets_log.info("✅ [Token Keep-Alive] Token đã được refresh thành công!")
                         # Notify admins that token is valid
                         try:
                             publish_token_status('valid', 'Token đã được refresh tự động thành công!')
@@ -7834,7 +7733,7 @@ def _token_keepalive_worker(interval_minutes=30):
                             pass
                     except Exception as refresh_err:
                         error_str = str(refresh_err).lower()
-                        print(f"⚠️ [Token Keep-Alive] Không thể refresh token tự động: {refresh_err}")
+                        sheets_log.warning("⚠️ [Token Keep-Alive] Không thể refresh token tự động: %s", refresh_err)
                         # Notify admins that token needs reauth
                         try:
                             if 'invalid_grant' in error_str:
@@ -7844,16 +7743,16 @@ def _token_keepalive_worker(interval_minutes=30):
                         except Exception:
                             pass
                 else:
-                    print(f"⚠️ [Token Keep-Alive] Token hết hạn và không có refresh_token. Cần admin bấm nút Refresh Token.")
+                    sheets_log.warning("⚠️ [Token Keep-Alive] Token hết hạn và không có refresh_token. Cần admin bấm nút Refresh Token.")
                     try:
                         publish_token_status('expired', 'Token hết hạn. Vui lòng bấm nút Refresh Token để ủy quyền lại.', needs_reauth=True)
                     except Exception:
                         pass
             else:
-                print(f"ℹ️ [Token Keep-Alive] Token vẫn còn hiệu lực")
+                sheets_log.debug("ℹ️ [Token Keep-Alive] Token vẫn còn hiệu lực")
             
         except Exception as e:
-            print(f"❌ [Token Keep-Alive] Lỗi: {e}")
+            sheets_log.error("❌ [Token Keep-Alive] Lỗi: %s", e)
         
         # Ngủ theo khoảng thời gian
         try:
@@ -7933,15 +7832,49 @@ def get_admin_users():
         print(f"❌ Lỗi khi lấy danh sách admin: {e}")
         return []
 
+def _report_db_path():
+    """Đường dẫn file SQLite chính (None nếu không phải SQLite -> báo cáo đọc thẳng DB)"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return None
+    return url.database
+
+def open_report_session(fresh=False):
+    """
+    Session cho export/báo cáo nặng: snapshot chỉ đọc nếu bật REPORT_SNAPSHOT_ENABLED,
+    ngược lại (hoặc fresh=True) là db.session như cũ. Phải close() sau khi dùng xong.
+    """
+    return report_snapshot.open(db.session, _report_db_path(), fresh=fresh)
+
+def _wants_fresh_report():
+    return request.args.get('fresh', '').lower() in ('1', 'true', 'yes')
+
+def report_session_for_request():
+    """
+    open_report_session() cho 1 request (?fresh=1 -> đọc DB chính): tự đóng session và gắn header
+    X-Data-Source / X-Data-Snapshot-At khi trả response. Không dùng cho response stream
+    (body sinh sau khi hàm này đã đóng session).
+    """
+    from flask import after_this_request
+
+    report = open_report_session(fresh=_wants_fresh_report())
+
+    @after_this_request
+    def _close_report_session(response):
+        report.close()
+        return report.apply_headers(response)
+
+    return report
+
 def check_december_data_complete(year):
     """Kiểm tra dữ liệu tháng 12 đã đầy đủ chưa"""
     try:
-        with app.app_context():
+        with app.app_context(), open_report_session() as report:
             from database.models import Attendance, User
             from datetime import date
             
             # Lấy tất cả users đang hoạt động
-            active_users = User.query.filter_by(is_deleted=False, is_active=True).all()
+            active_users = User.query.with_session(report.session).filter_by(is_deleted=False, is_active=True).all()
             
             # Kiểm tra từng user có dữ liệu đầy đủ trong tháng 12 không
             incomplete_users = []
@@ -7950,7 +7883,7 @@ def check_december_data_complete(year):
             
             for user in active_users:
                 # Đếm số ngày có dữ liệu chấm công trong tháng 12
-                attendance_count = Attendance.query.filter(
+                attendance_count = Attendance.query.with_session(report.session).filter(
                     Attendance.user_id == user.id,
                     Attendance.date >= december_start,
                     Attendance.date <= december_end
@@ -8171,6 +8104,18 @@ def start_all_background_services():
         ensure_license_check_started(interval_seconds=60)
     except Exception as e:
         print(f"[LICENSE] Lỗi khởi động license online checker: {e}")
+
+    # Khởi động worker outbox Google Sheet (làm tiếp việc còn dở trước khi restart)
+    try:
+        _ensure_google_sheets_queue_worker()
+    except Exception as e:
+        print(f"⚠️ Lỗi khởi động worker outbox Google Sheet: {e}")
+
+    # Khởi động worker outbox email (gửi nốt email còn chờ trước khi restart)
+    try:
+        email_outbox.start()
+    except Exception as e:
+        print(f"⚠️ Lỗi khởi động worker outbox email: {e}")
     
     print("✅ Tất cả dịch vụ nền đã được khởi động!")
 
@@ -8355,6 +8300,240 @@ def get_department_mapping():
         print(f"Lỗi khi lấy mapping phòng ban: {e}")
         return jsonify({'error': 'Lỗi hệ thống'}), 500
 
+@app.route('/api/google-drive/metadata-cache', methods=['GET', 'DELETE'])
+@login_required
+def google_metadata_cache_status():
+    """API xem thống kê hit/miss (GET) hoặc xoá (DELETE) cache metadata Google Drive/Sheets"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+        
+        if request.method == 'DELETE':
+            drive_metadata_cache.clear()
+            return jsonify({'message': 'Đã xoá cache metadata Google', 'stats': drive_metadata_cache.stats()}), 200
+        
+        return jsonify({'stats': drive_metadata_cache.stats()}), 200
+            
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê cache Google: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/signature-image-cache', methods=['GET', 'DELETE'])
+@login_required
+def signature_image_cache_status():
+    """API xem thống kê hit/miss (GET) hoặc xoá (DELETE) cache ảnh chữ ký dùng khi tạo PDF"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+        
+        if request.method == 'DELETE':
+            signature_image_cache.clear()
+            return jsonify({'message': 'Đã xoá cache ảnh chữ ký', 'stats': signature_image_cache.stats()}), 200
+        
+        return jsonify({'stats': signature_image_cache.stats()}), 200
+            
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê cache chữ ký: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/sse-broker', methods=['GET'])
+@login_required
+def sse_broker_status():
+    """API xem backend và số kết nối SSE (email/token status) đang mở trên worker hiện tại"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        return jsonify({'stats': sse_broker.stats(), 'pid': os.getpid()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê SSE broker: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/sqlite-status', methods=['GET'])
+@login_required
+def sqlite_status():
+    """API xem PRAGMA SQLite đang áp dụng và trạng thái pool kết nối của worker hiện tại"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if db.engine.dialect.name != 'sqlite':
+            return jsonify({'dialect': db.engine.dialect.name}), 200
+        return jsonify({
+            'pragmas': read_sqlite_pragmas(db.session.connection()),
+            'pool': db.engine.pool.status(),
+        }), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy trạng thái SQLite: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/activation-state', methods=['GET', 'DELETE'])
+@login_required
+def activation_state_status():
+    """API xem số lần nạp lại (GET) hoặc buộc đọc lại từ DB (DELETE) trạng thái kích hoạt đang cache"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if request.method == 'DELETE':
+            activation_state.invalidate(reason='admin')
+            return jsonify({'message': 'Trạng thái kích hoạt sẽ được đọc lại từ DB', 'stats': activation_state.stats()}), 200
+
+        return jsonify({'stats': activation_state.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê trạng thái kích hoạt: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/report-snapshot', methods=['GET', 'POST'])
+@login_required
+def report_snapshot_status():
+    """API xem độ cũ / số lần đọc của snapshot báo cáo (GET) hoặc chụp lại snapshot ngay (POST)"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if request.method == 'POST':
+            source_path = _report_db_path()
+            if not report_snapshot.enabled or not source_path:
+                return jsonify({'error': 'Snapshot báo cáo chưa bật (REPORT_SNAPSHOT_ENABLED=1, chỉ hỗ trợ SQLite)'}), 400
+            report_snapshot.refresh(source_path)
+            return jsonify({'message': 'Đã chụp lại snapshot báo cáo', 'stats': report_snapshot.stats()}), 200
+
+        return jsonify({'stats': report_snapshot.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê snapshot báo cáo: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/holiday-calendar', methods=['GET', 'DELETE'])
+@login_required
+def holiday_calendar_status():
+    """API xem lịch ngày lễ đang cache (GET) hoặc buộc nạp lại từ DB (DELETE)"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if request.method == 'DELETE':
+            holiday_calendar.invalidate(reason='admin')
+            return jsonify({'message': 'Lịch ngày lễ sẽ được nạp lại từ DB', 'stats': holiday_calendar.stats()}), 200
+
+        return jsonify({'stats': holiday_calendar.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê lịch ngày lễ: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/pending-counters', methods=['GET', 'DELETE'])
+@login_required
+def pending_counters_status():
+    """API xem bộ đếm chờ phê duyệt (GET) hoặc buộc đối soát lại từ DB (DELETE)"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if request.method == 'DELETE':
+            pending_counters.reconcile()
+            return jsonify({'message': 'Đã đối soát bộ đếm từ DB', 'stats': pending_counters.stats()}), 200
+
+        return jsonify({'stats': pending_counters.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê bộ đếm chờ phê duyệt: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/session-store', methods=['GET'])
+@login_required
+def session_store_status():
+    """API xem session phía server: backend, số session đang hoạt động, số lần đọc / ghi"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if session_store is None:
+            return jsonify({'stats': {'backend': 'cookie'}}), 200
+        return jsonify({'stats': session_store.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê session store: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/log-pipeline', methods=['GET'])
+@login_required
+def log_pipeline_status():
+    """API xem trạng thái pipeline log: level từng phân hệ, hàng đợi, số dòng bị bỏ"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        return jsonify({'stats': log_pipeline.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê pipeline log: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/sheet-sync-outbox', methods=['GET', 'POST'])
+@login_required
+def sheet_sync_outbox_status():
+    """API xem outbox Google Sheet (GET) hoặc đưa toàn bộ việc 'failed' về hàng chờ (POST)"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if request.method == 'POST':
+            count = sheet_sync_outbox.retry_failed()
+            return jsonify({'message': f'Đã đưa {count} việc lỗi về hàng chờ', 'stats': sheet_sync_outbox.stats()}), 200
+
+        return jsonify({'stats': sheet_sync_outbox.stats(), 'quota': google_quota.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê outbox Google Sheet: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
+@app.route('/api/admin/email-outbox', methods=['GET', 'POST'])
+@login_required
+def email_outbox_status():
+    """API xem outbox email (GET) hoặc đưa toàn bộ email 'failed' về hàng chờ (POST)"""
+    try:
+        # Kiểm tra quyền admin
+        user = db.session.get(User, session['user_id'])
+        if not user or 'ADMIN' not in user.roles.split(','):
+            return jsonify({'error': 'Không có quyền truy cập'}), 403
+
+        if request.method == 'POST':
+            count = email_outbox.retry_failed()
+            return jsonify({'message': f'Đã đưa {count} email lỗi về hàng chờ', 'stats': email_outbox.stats()}), 200
+
+        return jsonify({'stats': email_outbox.stats()}), 200
+
+    except Exception as e:
+        print(f"Lỗi khi lấy thống kê outbox email: {e}")
+        return jsonify({'error': 'Lỗi hệ thống'}), 500
+
 # --- Helper function để xử lý định dạng thời gian SA/CH/AM/PM ---
 def clean_time_format(time_str):
     """Xử lý định dạng thời gian có SA/CH/AM/PM"""
@@ -8424,6 +8603,8 @@ def _compute_leave_units_generic(from_date_dt: datetime, from_time_str: str, to_
 # Load configuration
 config_name = os.environ.get('FLASK_CONFIG') or 'default'
 app.config.from_object(config[config_name])
+# Session phía server: cookie chỉ mang session id, chữ ký / dữ liệu session nằm trong store - xem utils/session_store.py
+session_store = init_session_store(app)
 
 # Initialize CSRF protection
 csrf = CSRFProtect(app)
@@ -8488,6 +8669,21 @@ def inject_format_helpers():
 # Initialize database
 db.init_app(app)
 migrate = Migrate(app, db)
+# PRAGMA cho từng kết nối SQLite (WAL, synchronous=NORMAL, busy_timeout...) - xem utils/sqlite_tuning.py
+with app.app_context():
+    install_sqlite_pragmas(db.engine)
+
+# Bộ đếm chờ phê duyệt (badge, pending-count, freshness) cập nhật theo commit - xem utils/pending_counters.py
+pending_counters.attach(db.session, User, Attendance, LeaveRequest)
+# Cache tổng số của danh sách chấm công (utils/query_optimizer.py) bị xoá sau mỗi commit ghi Attendance / User
+attach_count_cache_invalidation(db.session)
+
+# Outbox cập nhật Google Sheet (worker khởi động cùng dịch vụ nền hoặc ở lần enqueue đầu tiên)
+sheet_sync_outbox.init_app(app, batch_update_multi_attendances_sync)
+
+# Outbox email (thông báo đơn nghỉ, đặt lại mật khẩu): 1 worker gửi trên kết nối SMTP dùng lại,
+# trạng thái ghi qua record_email_status và publish thẳng lên SSE
+email_outbox.init_app(app, on_status=record_email_status)
 
 # Initialize signature manager
 signature_manager.init_app(app)
@@ -8542,10 +8738,26 @@ def get_activation_record():
     return None
 
 
+def _load_activation_snapshot():
+    """Đọc bản ghi kích hoạt từ DB cho activation_state (chỉ chạy khi nạp lại, không phải mỗi request)"""
+    return ActivationSnapshot.from_record(get_activation_record())
+
+
+def _load_year_holidays(year):
+    """Ngày lễ của 1 năm cho holiday_calendar (chỉ chạy khi nạp lại năm đó, không phải mỗi request)"""
+    from datetime import date as _date_mod
+    rows = (db.session.query(Holiday.date, Holiday.holiday_type, Holiday.name)
+            .filter(Holiday.date >= _date_mod(year, 1, 1), Holiday.date <= _date_mod(year, 12, 31))
+            .all())
+    return [(row.date, row.holiday_type, row.name) for row in rows]
+
+
+holiday_calendar.set_loader(_load_year_holidays)
+
+
 def is_app_activated():
-    """Kiểm tra ứng dụng đã được kích hoạt hay chưa."""
-    activation = get_activation_record()
-    return bool(activation and activation.is_activated)
+    """Kiểm tra ứng dụng đã được kích hoạt hay chưa (đọc từ activation_state, không query DB mỗi request)."""
+    return activation_state.get(_load_activation_snapshot).is_activated
 
 
 def get_license_key():
@@ -8564,19 +8776,19 @@ def get_license_key():
     # Kiểm tra xem database có key khác không (để cảnh báo nếu có sự không nhất quán)
     activation = None
     try:
-        activation = get_activation_record()
+        activation = activation_state.get(_load_activation_snapshot)
     except Exception as e:
         # Chỉ log nếu không phải lỗi application context (vì có thể gọi ngoài context)
         if "application context" not in str(e).lower():
-            print(f"[LICENSE] Lỗi lấy activation record: {e}")
+            license_log.debug("[LICENSE] Lỗi lấy activation record: %s", e)
     
     db_key = None
     if activation is not None:
-        db_key = (getattr(activation, 'license_key', None) or '').strip()
+        db_key = (activation.license_key or '').strip()
     
     # Cảnh báo nếu key trong database khác với environment variable
     if license_key and db_key and license_key != db_key:
-        print(f"[LICENSE] ⚠️ CẢNH BÁO: Key trong database ('{db_key[:10]}...') khác với environment variable ('{license_key[:10]}...'). Đang dùng key từ environment variable.", flush=True)
+        license_log.debug("[LICENSE] ⚠️ CẢNH BÁO: Key trong database ('%s...') khác với environment variable ('%s...'). Đang dùng key từ environment variable.", db_key[:10], license_key[:10])
     
     # Nếu không có environment variable, mới lấy từ database
     if not license_key:
@@ -8654,12 +8866,11 @@ def export_attendance_history_excel():
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
         response.headers.add('Access-Control-Allow-Methods', 'GET, OPTIONS')
         return response
-    import sys
-    print(f"[EXPORT EXCEL] ====== HÀM ĐƯỢC GỌI ====== Path: {request.path}, Method: {request.method}, Endpoint: {request.endpoint}", file=sys.stderr, flush=True)
-    print(f"[EXPORT EXCEL] ====== HÀM ĐƯỢC GỌI ====== Path: {request.path}, Method: {request.method}, Endpoint: {request.endpoint}", flush=True)
-    print(f"[EXPORT EXCEL] Request URL: {request.url}, Full Path: {request.full_path}", flush=True)
-    print(f"[EXPORT EXCEL] Remote Addr: {request.remote_addr}", flush=True)
-    print(f"[EXPORT EXCEL] Headers: {dict(request.headers)}", flush=True)
+    export_log.debug("[EXPORT EXCEL] ====== HÀM ĐƯỢC GỌI ====== Path: %s, Method: %s, Endpoint: %s", request.path, request.method, request.endpoint)
+    export_log.debug("[EXPORT EXCEL] ====== HÀM ĐƯỢC GỌI ====== Path: %s, Method: %s, Endpoint: %s", request.path, request.method, request.endpoint)
+    export_log.debug("[EXPORT EXCEL] Request URL: %s, Full Path: %s", request.url, request.full_path)
+    export_log.debug("[EXPORT EXCEL] Remote Addr: %s", request.remote_addr)
+    export_log.debug("[EXPORT EXCEL] Headers: %s", dict(request.headers))
     try:
         logger.info("[EXPORT EXCEL] Bắt đầu xuất Excel lịch sử chấm công")
         
@@ -8683,7 +8894,9 @@ def export_attendance_history_excel():
 
         logger.info(f"[EXPORT EXCEL] User {user.id} ({user.name}) đang xuất Excel")
         
-        from utils.query_optimizer import optimize_attendance_history_query
+        import itertools
+        from utils.query_optimizer import build_attendance_history_query, signature_flag_options
+        from utils.excel_stream_export import StreamingXlsxWriter, iter_query_in_chunks
 
         # Lấy tham số lọc giống API lịch sử chấm công
         search = (request.args.get('search') or '').strip()
@@ -8753,42 +8966,24 @@ def export_attendance_history_excel():
             logger.warning("[EXPORT EXCEL] Không có bộ lọc nào được cung cấp")
             return jsonify({'error': 'Không có giá trị nào để xuất. Vui lòng chọn ngày/tháng/năm hoặc bộ lọc.'}), 400
 
-        # Lấy toàn bộ bản ghi (đã phê duyệt) theo bộ lọc
+        # Đọc bản ghi (đã phê duyệt) theo bộ lọc theo từng lô, không nạp ảnh chữ ký
         logger.info("[EXPORT EXCEL] Đang truy vấn dữ liệu chấm công...")
-        attendances, total = optimize_attendance_history_query(
+        report = report_session_for_request()
+        query = build_attendance_history_query(
             search=search or None,
             department=department or None,
             date_from=date_from,
             date_to=date_to,
             user_id=user.id,
-            page=1,
-            per_page=100000,  # Get all records for export
             is_admin=True
-        )
-        
-        logger.info(f"[EXPORT EXCEL] Tìm thấy {total} bản ghi, lấy được {len(attendances)} bản ghi")
+        ).with_session(report.session).options(*signature_flag_options()).order_by(Attendance.date.desc(), Attendance.id.desc())
+        attendance_iter = iter_query_in_chunks(query)
 
-        if not attendances:
+        first_att = next(attendance_iter, None)
+        if first_att is None:
             logger.warning("[EXPORT EXCEL] Không có dữ liệu chấm công để xuất")
             return jsonify({'error': 'Không có dữ liệu chấm công để xuất Excel'}), 404
 
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Lịch sử chấm công"
-
-        # Định dạng header
-        header_font = Font(bold=True)
-        header_alignment = Alignment(horizontal="center", vertical="center")
-        center_alignment = Alignment(horizontal="center", vertical="center")
-        left_alignment = Alignment(horizontal="left", vertical="center")
-        right_alignment = Alignment(horizontal="right", vertical="center")
-        thin_border = Border(
-            left=Side(style="thin"),
-            right=Side(style="thin"),
-            top=Side(style="thin"),
-            bottom=Side(style="thin")
-        )
-
         headers = [
             "Ngày",
             "Nhân viên",
@@ -8804,12 +8999,15 @@ def export_attendance_history_excel():
             "Tăng ca sau 22h",
             "Loại ngày"
         ]
-
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.alignment = header_alignment
-            cell.border = thin_border
+        # Write-only không AutoFit được -> độ rộng cố định (B rộng cho tên dài, C -> M nới rộng để dễ đọc)
+        column_widths = [12, 60, 20, 30, 20, 20, 20, 20, 28, 20, 38, 34, 26]
+        # A: ngày, B: tên NV để trái, C/D: text (tránh Excel hiểu nhầm là thời gian), E -> L: HH:mm, M: loại ngày
+        row_styles = (
+            ['export_grid_date', 'export_grid_left', 'export_grid_text', 'export_grid_text']
+            + ['export_grid_time'] * 8
+            + ['export_grid_text']
+        )
+        writer = StreamingXlsxWriter("Lịch sử chấm công", headers, column_widths)
 
         # Helper tính tổng đối ứng (HH:MM) – giữ dạng chuỗi để tránh mất dữ liệu khi convert
         def _calc_comp_total(att_obj):
@@ -8840,9 +9038,8 @@ def export_attendance_history_excel():
             return f"{total_minutes // 60}:{total_minutes % 60:02d}"
 
         # Ghi dữ liệu
-        row_idx = 2
-        for att in attendances:
-            att_dict = att.to_dict()
+        for att in itertools.chain([first_att], attendance_iter):
+            att_dict = att.to_dict(include_signatures=False)
             user_obj = att.user
 
             ngay_val = att.date
@@ -8869,7 +9066,7 @@ def export_attendance_history_excel():
             ot_sau_22 = att_dict.get("overtime_after_22") or "0:00"
             loai_ngay = att_dict.get("holiday_type") or "-"
 
-            values = [
+            writer.append([
                 ngay_val,
                 nhanvien_val,
                 manv_val,
@@ -8883,102 +9080,21 @@ def export_attendance_history_excel():
                 ot_truoc_22,
                 ot_sau_22,
                 loai_ngay,
-            ]
-
-            for col, val in enumerate(values, 1):
-                cell = ws.cell(row=row_idx, column=col)
-                cell.border = thin_border
-
-                # Định dạng theo loại cột
-                if col == 1:
-                    cell.value = val
-                    cell.number_format = "dd/mm/yyyy"
-                    cell.alignment = center_alignment
-                elif col in [2, 13]:  # B: tên NV để trái, M: loại ngày giữ trái
-                    cell.value = val
-                    cell.alignment = left_alignment
-                elif col in [3, 4]:  # C: Mã nhân viên, D: Phòng ban - định dạng text
-                    # Đảm bảo giá trị được lưu dưới dạng text để tránh Excel hiểu nhầm là thời gian
-                    # Set format text TRƯỚC khi set value để Excel không tự động convert
-                    cell.number_format = "@"  # Text format (@ = text trong Excel)
-                    # Giá trị đã được convert sang string ở trên, chỉ cần set vào cell
-                    # Đảm bảo không phải None
-                    text_value = str(val).strip() if val is not None and val != "" else ""
-                    cell.value = text_value
-                    cell.alignment = center_alignment
-                else:
-                    cell.value = val
-                    cell.number_format = "HH:mm"
-                    cell.alignment = center_alignment
-
-            row_idx += 1
-
-        # AutoFit độ rộng cột
-        for col_idx in range(1, len(headers) + 1):
-            column = get_column_letter(col_idx)
-            max_len = 0
-            for cell in ws[column]:
-                try:
-                    cell_val = cell.value
-                    if isinstance(cell_val, (datetime, date, time)):
-                        text = cell_val.strftime("%d/%m/%Y") if col_idx == 1 else cell_val.strftime("%H:%M")
-                    else:
-                        text = str(cell_val) if cell_val is not None else ""
-                    if len(text) > max_len:
-                        max_len = len(text)
-                except Exception:
-                    continue
-            ws.column_dimensions[column].width = max(10, min(max_len + 2, 40))
-
-        # Tùy chỉnh rộng hơn cho cột B (Nhân viên) để đủ tên dài
-        current_b_width = ws.column_dimensions["B"].width or 10
-        ws.column_dimensions["B"].width = min(current_b_width * 3, 60)  # gấp 3, giới hạn 60
-
-        # Nới rộng các cột C -> M (3 -> 13) gấp đôi để dễ đọc
-        for col_idx in range(3, 14):
-            col_letter = get_column_letter(col_idx)
-            current_width = ws.column_dimensions[col_letter].width or 10
-            ws.column_dimensions[col_letter].width = min(current_width * 2, 80)
-
-        # Căn giữa cho cột C, D (Mã nhân viên, Phòng ban) và cột M (Loại ngày) sau khi set width
-        for row in ws.iter_rows(min_row=2, max_row=row_idx - 1, min_col=3, max_col=4):
-            for cell in row:
-                cell.alignment = center_alignment
-        for cell in ws.iter_rows(min_row=2, max_row=row_idx - 1, min_col=13, max_col=13):
-            for c in cell:
-                c.alignment = center_alignment
+            ], styles=row_styles)
 
         # Lọc tự động cho header
-        ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}{row_idx-1}"
-
-        # Lưu file vào bộ nhớ
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+        writer.set_auto_filter()
 
         vn_filename = f"Lich_su_cham_cong_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        from urllib.parse import quote
-        ascii_fallback = "lich_su_cham_cong.xlsx"
-        content_disposition = (
-            f"attachment; filename=\"{ascii_fallback}\"; "
-            f"filename*=UTF-8''{quote(vn_filename)}"
-        )
+        response = writer.to_response(vn_filename, ascii_fallback="lich_su_cham_cong.xlsx")
 
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = content_disposition
-        response.headers['Content-Length'] = len(output.getvalue())
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-
-        logger.info(f"[EXPORT EXCEL] Xuất Excel thành công, {len(attendances)} bản ghi")
+        logger.info(f"[EXPORT EXCEL] Xuất Excel thành công, {writer.rows_written} bản ghi")
         return response
 
     except Exception as e:
         error_msg = f"[ERROR] Error exporting attendance Excel: {e}"
         logger.error(error_msg, exc_info=True)
-        print(error_msg)
+        export_log.debug("%s", error_msg)
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Lỗi khi xuất file Excel chấm công: {str(e)}'}), 500
@@ -9206,10 +9322,6 @@ def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Process any pending DB updates from async email threads
-    from utils.email_utils import process_db_updates
-    process_db_updates()
-    
     user = db.session.get(User, session['user_id'])
     if not user:
         session.clear()
@@ -9272,14 +9384,8 @@ def dashboard():
     # Nếu là ADMIN, kiểm tra cảnh báo ngày lễ để hiển thị trên dashboard
     if 'ADMIN' in (user.roles or '').split(','):
         try:
-            from datetime import date as _date_mod
-            current_year = datetime.now().year
-            # Có ít nhất 1 ngày lễ trong năm hiện tại chưa?
-            year_holidays = Holiday.query.filter(
-                Holiday.date >= _date_mod(current_year, 1, 1),
-                Holiday.date <= _date_mod(current_year, 12, 31)
-            ).count()
-            if year_holidays == 0:
+            # Có ít nhất 1 ngày lễ trong năm hiện tại chưa? (đọc từ lịch cache, không query mỗi lần mở)
+            if holiday_calendar.holiday_count(datetime.now().year) == 0:
                 flash('⚠️ Hiện chưa cấu hình ngày lễ nào cho năm hiện tại. Vui lòng vào "Quản lý ngày lễ" để thêm.', 'warning')
         except Exception:
             # Không để lỗi phụ làm vỡ dashboard
@@ -9655,6 +9761,9 @@ def get_attendance_history():
         if not user:
             return jsonify({'error': 'Không tìm thấy người dùng'}), 404
         current_role = session.get('current_role', user.roles.split(',')[0])
+        # Chế độ danh sách mặc định KHÔNG trả ảnh chữ ký (chỉ trả cờ has_*);
+        # lấy chữ ký theo yêu cầu qua /api/attendance/<id>/signatures hoặc ?include_signatures=1
+        include_signatures = request.args.get('include_signatures') == '1'
         if request.args.get('all') == '1':
             if current_role != 'ADMIN':
                 return jsonify({'error': 'Chỉ quản trị viên mới có thể xem lịch sử chấm công toàn bộ'}), 403
@@ -9751,12 +9860,28 @@ def get_attendance_history():
             if page is None or per_page is None:
                 return jsonify({'error': 'Tham số phân trang không hợp lệ'}), 400
                 
+            # Phân trang keyset khi client gửi ?cursor= (rỗng = trang đầu); không có thì dùng page/offset như cũ
+            cursor = request.args.get('cursor')
+            include_total = request.args.get('include_total', '1') != '0'
+            page_info = None
+            
             # Use optimized query for fastest performance
             from utils.query_optimizer import optimize_attendance_history_query
-            attendances, total = optimize_attendance_history_query(
-                search=search, department=department, date_from=date_from, date_to=date_to,
-                user_id=user.id, page=page, per_page=per_page, is_admin=True
-            )
+            if cursor is not None:
+                try:
+                    attendances, total, page_info = optimize_attendance_history_query(
+                        search=search, department=department, date_from=date_from, date_to=date_to,
+                        user_id=user.id, per_page=per_page, is_admin=True,
+                        include_signatures=include_signatures, cursor=cursor, include_total=include_total
+                    )
+                except ValueError:
+                    return jsonify({'error': 'Cursor phân trang không hợp lệ'}), 400
+            else:
+                attendances, total = optimize_attendance_history_query(
+                    search=search, department=department, date_from=date_from, date_to=date_to,
+                    user_id=user.id, page=page, per_page=per_page, is_admin=True,
+                    include_signatures=include_signatures
+                )
             
             # Debug log kết quả query
             if app.debug:
@@ -9766,7 +9891,7 @@ def get_attendance_history():
             # Disable caching for admin history data
             history = []
             for att in attendances:
-                att_dict = att.to_dict()
+                att_dict = att.to_dict(include_signatures=include_signatures)
                 att_dict['user_name'] = att.user.name if att.user else '-'
                 att_dict['department'] = att.user.department if att.user else '-'
                 att_dict['approver_name'] = att.approver.name if att.approver else '-'
@@ -9777,12 +9902,15 @@ def get_attendance_history():
 
                 history.append(att_dict)
 
-            return jsonify({
+            response_data = {
                 'total': total,
                 'page': page,
                 'per_page': per_page,
                 'data': history
-            })
+            }
+            if page_info is not None:
+                response_data.update(page_info)
+            return jsonify(response_data)
         else:
             # Lấy tham số lọc theo tháng
             month = validate_int(request.args.get('month', '').strip()) if request.args.get('month') else None
@@ -9811,14 +9939,15 @@ def get_attendance_history():
             from utils.query_optimizer import optimize_attendance_history_query
             attendances, total = optimize_attendance_history_query(
                 user_id=user.id, page=1, per_page=1000, is_admin=False,
-                date_from=date_from, date_to=date_to
+                date_from=date_from, date_to=date_to,
+                include_signatures=include_signatures
             )
 
             print(f"[DEBUG] Query returned {total} records for user {user.id}")
 
             history = []
             for att in attendances:
-                history.append(att.to_dict())
+                history.append(att.to_dict(include_signatures=include_signatures))
 
             print(f"[DEBUG] Returning {len(history)} records to frontend")
 
@@ -9930,7 +10059,6 @@ def bulk_recreate_attendance():
         
         # Nhóm các bản ghi theo user_id và date, chọn bản ghi tốt nhất cho mỗi nhóm
         # Ưu tiên: approved > pending_admin > pending_manager > pending > rejected
-        from collections import defaultdict
         status_priority = {
             'approved': 1,
             'pending_admin': 2,
@@ -10567,6 +10695,7 @@ def admin_holidays():
             )
             db.session.add(new_holiday)
             db.session.commit()
+            holiday_calendar.invalidate(date.year, reason='admin_holidays_add')
             
             flash(f'Đã thêm ngày lễ thành công!', 'success')
             
@@ -10603,11 +10732,15 @@ def admin_holidays():
                 flash(f'Ngày {date_str} đã được đánh dấu là {existing.holiday_type}!', 'error')
                 return redirect(url_for('admin_holidays'))
             
+            old_year = holiday.date.year
             holiday.date = date
             holiday.holiday_type = holiday_type
             holiday.name = name if name else None
             holiday.description = description if description else None
             db.session.commit()
+            holiday_calendar.invalidate(old_year, reason='admin_holidays_edit')
+            if date.year != old_year:
+                holiday_calendar.invalidate(date.year, reason='admin_holidays_edit')
             
             flash(f'Đã cập nhật ngày lễ thành công!', 'success')
                 
@@ -10616,8 +10749,10 @@ def admin_holidays():
             holiday = Holiday.query.get(holiday_id)
             if holiday:
                 date_str = holiday.date.strftime('%d/%m/%Y')
+                holiday_year = holiday.date.year
                 db.session.delete(holiday)
                 db.session.commit()
+                holiday_calendar.invalidate(holiday_year, reason='admin_holidays_delete')
                 
                 flash(f'Đã xóa ngày lễ {date_str} thành công!', 'success')
             else:
@@ -10640,7 +10775,6 @@ def get_day_type():
     try:
         
         date_str = request.args.get('date')
-        print(f"DEBUG: date_str = {date_str}")
         if not date_str:
             return jsonify({'error': 'Vui lòng cung cấp ngày'}), 400
         
@@ -10650,36 +10784,25 @@ def get_day_type():
         except ValueError:
             return jsonify({'error': 'Ngày không hợp lệ'}), 400
         
-        # Kiểm tra thứ trong tuần (0 = Monday, 6 = Sunday)
-        weekday = date.weekday()  # 0-6 (Monday-Sunday)
-        is_weekend = weekday >= 5  # Saturday (5) or Sunday (6)
-        
-        # Kiểm tra ngày lễ trong database (với xử lý lỗi nếu bảng chưa tồn tại)
-        holiday = None
-        try:
-            holiday = Holiday.query.filter_by(date=date).first()
-        except Exception as e:
-            # Nếu bảng holidays chưa tồn tại, bỏ qua và chỉ dựa vào thứ trong tuần
-            print(f"Warning: Không thể query Holiday table: {e}")
-            holiday = None
-        
-        # Độ ưu tiên: Lễ Việt Nam > Cuối tuần > Lễ Nhật
-        if holiday and holiday.holiday_type == 'vietnamese_holiday':
+        # Lịch cache theo năm (độ ưu tiên: Lễ Việt Nam > Cuối tuần > Lễ Nhật); bảng holidays
+        # chưa tồn tại -> lịch chỉ dựa vào thứ trong tuần
+        day_type = holiday_calendar.day_type(date)
+        if day_type == 'vietnamese_holiday':
             return jsonify({
                 'day_type': 'vietnamese_holiday',
                 'reason': 'Lễ Việt Nam',
-                'holiday_name': holiday.name if holiday.name else None
+                'holiday_name': holiday_calendar.holiday_name(date) or None
             })
-        elif is_weekend:
+        elif day_type == 'weekend':
             return jsonify({
                 'day_type': 'weekend',
                 'reason': 'Cuối tuần'
             })
-        elif holiday and holiday.holiday_type == 'japanese_holiday':
+        elif day_type == 'japanese_holiday':
             return jsonify({
                 'day_type': 'japanese_holiday',
                 'reason': 'Lễ Nhật Bản',
-                'holiday_name': holiday.name if holiday.name else None
+                'holiday_name': holiday_calendar.holiday_name(date) or None
             })
         else:
             return jsonify({
@@ -10714,74 +10837,20 @@ def get_excluded_days():
             return jsonify({'error': 'Vui lòng cung cấp from_date và to_date'}), 400
 
         try:
-            from datetime import datetime, timedelta
+            from datetime import datetime
             from_date = datetime.strptime(from_date_str, '%Y-%m-%d').date()
             to_date = datetime.strptime(to_date_str, '%Y-%m-%d').date()
         except ValueError:
             return jsonify({'error': 'Ngày không hợp lệ (format: YYYY-MM-DD)'}), 400
 
-        if from_date > to_date:
-            return jsonify({'error': 'from_date phải nhỏ hơn hoặc bằng to_date'}), 400
-
-        excluded_days = []
-        current_date = from_date
-
-        # Lấy tất cả ngày lễ trong khoảng thời gian từ database
-        holidays_in_range = {}
         try:
-            holidays = Holiday.query.filter(
-                Holiday.date >= from_date,
-                Holiday.date <= to_date
-            ).all()
-            for h in holidays:
-                holidays_in_range[h.date] = {
-                    'type': h.holiday_type,
-                    'name': h.name or ''
-                }
-        except Exception as e:
-            print(f"Warning: Không thể query Holiday table: {e}")
-
-        # Duyệt qua từng ngày trong khoảng
-        while current_date <= to_date:
-            weekday = current_date.weekday()  # 0=Monday, 6=Sunday
-            is_weekend = weekday >= 5  # Saturday (5) or Sunday (6)
-
-            date_str = current_date.strftime('%Y-%m-%d')
-
-            # Kiểm tra ngày lễ Việt Nam (ưu tiên cao nhất)
-            if current_date in holidays_in_range and holidays_in_range[current_date]['type'] == 'vietnamese_holiday':
-                excluded_days.append({
-                    'date': date_str,
-                    'type': 'vietnamese_holiday',
-                    'reason': 'Lễ Việt Nam',
-                    'name': holidays_in_range[current_date]['name']
-                })
-            # Kiểm tra cuối tuần
-            elif is_weekend:
-                day_name = 'Thứ 7' if weekday == 5 else 'Chủ nhật'
-                excluded_days.append({
-                    'date': date_str,
-                    'type': 'weekend',
-                    'reason': f'Cuối tuần ({day_name})',
-                    'name': ''
-                })
-            # Kiểm tra ngày lễ Nhật Bản
-            elif current_date in holidays_in_range and holidays_in_range[current_date]['type'] == 'japanese_holiday':
-                excluded_days.append({
-                    'date': date_str,
-                    'type': 'japanese_holiday',
-                    'reason': 'Lễ Nhật Bản',
-                    'name': holidays_in_range[current_date]['name']
-                })
+            result = holiday_calendar.describe_range(from_date, to_date)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-            current_date += timedelta(days=1)
-
-        return jsonify({
-            'excluded_days': excluded_days,
-            'total_excluded': len(excluded_days),
-            'from_date': from_date_str,
-            'to_date': to_date_str
-        })
+        # Giữ nguyên chuỗi ngày client gửi lên như trước
+        result.update(from_date=from_date_str, to_date=to_date_str)
+        return jsonify(result)
 
     except Exception as e:
         import traceback
@@ -10793,13 +10862,46 @@ def get_excluded_days():
         }), 500
 
 
+@app.route('/api/get-excluded-days/batch', methods=['GET'])
+def get_excluded_days_batch():
+    """Ngày loại trừ + số ngày làm việc cho nhiều khoảng trong 1 request
+    ?ranges=YYYY-MM-DD:YYYY-MM-DD,YYYY-MM-DD:YYYY-MM-DD
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Chưa đăng nhập', 'ranges': []}), 401
+
+    raw_ranges = [r for r in (request.args.get('ranges') or '').split(',') if r.strip()]
+    if not raw_ranges:
+        return jsonify({'error': 'Vui lòng cung cấp ranges=from_date:to_date,...'}), 400
+    if len(raw_ranges) > 50:
+        return jsonify({'error': 'Tối đa 50 khoảng ngày mỗi lần'}), 400
+
+    try:
+        from datetime import datetime
+        ranges = []
+        for raw in raw_ranges:
+            from_str, _, to_str = raw.strip().partition(':')
+            ranges.append((datetime.strptime(from_str, '%Y-%m-%d').date(),
+                           datetime.strptime(to_str, '%Y-%m-%d').date()))
+    except ValueError:
+        return jsonify({'error': 'Khoảng ngày không hợp lệ (format: YYYY-MM-DD:YYYY-MM-DD)'}), 400
+
+    try:
+        return jsonify({'ranges': holiday_calendar.describe_ranges(ranges)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in get_excluded_days_batch: {e}")
+        return jsonify({'error': 'Lỗi khi lấy danh sách ngày loại trừ', 'ranges': []}), 500
+
+
 @app.route('/api/admin/pending-sync', methods=['GET'])
 @require_admin
 def get_pending_sync_requests():
     """API để xem danh sách các đơn nghỉ phép đã approved nhưng chưa đồng bộ lên Google Sheet"""
     try:
-        # Lấy các đơn đã approved nhưng chưa sync hoặc sync thất bại
-        pending_sync = LeaveRequest.query.filter(
+        # Các đơn đã approved nhưng chưa sync (google_sheet_* do worker outbox cập nhật)
+        not_synced = LeaveRequest.query.filter(
             LeaveRequest.status == 'approved',
             db.or_(
                 LeaveRequest.google_sheet_synced == False,
@@ -10807,17 +10909,11 @@ def get_pending_sync_requests():
             )
         ).order_by(LeaveRequest.admin_approved_at.desc()).all()
 
-        # Lấy các đơn đã sync thất bại (có lỗi)
-        failed_sync = LeaveRequest.query.filter(
-            LeaveRequest.status == 'approved',
-            LeaveRequest.google_sheet_synced == False,
-            LeaveRequest.google_sheet_sync_error != None
-        ).order_by(LeaveRequest.admin_approved_at.desc()).all()
+        # Trạng thái outbox của từng đơn: số việc đang chờ / lỗi hẳn, lần thử kế tiếp, lỗi gần nhất
+        outbox_status = sheet_sync_outbox.leave_status(lr.id for lr in not_synced)
 
-        # Format kết quả
-        pending_list = []
-        for lr in pending_sync:
-            pending_list.append({
+        def _format_item(lr, status):
+            return {
                 'id': lr.id,
                 'employee_name': lr.employee_name,
                 'employee_code': lr.employee_code,
@@ -10826,26 +10922,26 @@ def get_pending_sync_requests():
                 'leave_to': f"{lr.leave_to_day:02d}/{lr.leave_to_month:02d}/{lr.leave_to_year}",
                 'total_days': lr.get_total_requested_days(),
                 'approved_at': lr.admin_approved_at.strftime('%d/%m/%Y %H:%M') if lr.admin_approved_at else None,
-                'sync_attempts': lr.google_sheet_sync_attempts or 0,
-                'sync_error': lr.google_sheet_sync_error,
-                'request_type': lr.request_type
-            })
+                'sync_attempts': max(lr.google_sheet_sync_attempts or 0, status['attempts'] if status else 0),
+                'sync_error': (status['last_error'] if status else None) or lr.google_sheet_sync_error,
+                'request_type': lr.request_type,
+                'outbox': {
+                    'pending': status['pending'] + status['processing'],
+                    'failed': status['failed'],
+                    'done': status['done'],
+                    'next_retry_at': status['next_retry_at'].isoformat(timespec='seconds') if status['next_retry_at'] else None,
+                } if status else None,
+            }
 
+        # Lỗi hẳn = outbox có việc 'failed' (hết lượt thử), hoặc lỗi khi lên lịch (chưa vào outbox)
+        pending_list = []
         failed_list = []
-        for lr in failed_sync:
-            failed_list.append({
-                'id': lr.id,
-                'employee_name': lr.employee_name,
-                'employee_code': lr.employee_code,
-                'team': lr.team,
-                'leave_from': f"{lr.leave_from_day:02d}/{lr.leave_from_month:02d}/{lr.leave_from_year}",
-                'leave_to': f"{lr.leave_to_day:02d}/{lr.leave_to_month:02d}/{lr.leave_to_year}",
-                'total_days': lr.get_total_requested_days(),
-                'approved_at': lr.admin_approved_at.strftime('%d/%m/%Y %H:%M') if lr.admin_approved_at else None,
-                'sync_attempts': lr.google_sheet_sync_attempts or 0,
-                'sync_error': lr.google_sheet_sync_error,
-                'request_type': lr.request_type
-            })
+        for lr in not_synced:
+            status = outbox_status.get(lr.id)
+            item = _format_item(lr, status)
+            pending_list.append(item)
+            if (status and status['failed']) or (not status and lr.google_sheet_sync_error):
+                failed_list.append(item)
 
         return jsonify({
             'success': True,
@@ -10858,7 +10954,8 @@ def get_pending_sync_requests():
                 'items': failed_list
             },
             'total_pending': len(pending_list),
-            'total_failed': len(failed_list)
+            'total_failed': len(failed_list),
+            'outbox': sheet_sync_outbox.stats()
         })
 
     except Exception as e:
@@ -10916,9 +11013,10 @@ def retry_sync_request(request_id):
                 'token_status': token_status
             }), 400
 
-        # Reset trạng thái lỗi và trigger sync lại
+        # Reset trạng thái lỗi (cả việc 'failed' trong outbox) và trigger sync lại
         leave_request.google_sheet_sync_error = None
         db.session.commit()
+        sheet_sync_outbox.retry_failed(request_id)
 
         # Trigger async sync
         trigger_schedule_leave_sheet_updates_async(request_id, user_id)
@@ -11005,6 +11103,7 @@ def bulk_retry_sync():
             # Reset lỗi và trigger sync
             lr.google_sheet_sync_error = None
             db.session.commit()
+            sheet_sync_outbox.retry_failed(rid)
             trigger_schedule_leave_sheet_updates_async(rid, user_id)
             retried.append(rid)
 
@@ -11345,7 +11444,9 @@ def submit_request():
         return jsonify({'error': 'Ngày bắt đầu phải trước ngày kết thúc'}), 400
     if start_date < datetime.now().date():
         return jsonify({'error': 'Không thể tạo yêu cầu cho ngày trong quá khứ'}), 400
-    leader = User.query.filter_by(department=user.department, roles='TEAM_LEADER', is_deleted=False).first()
+    leader = User.query.filter(
+        User.in_department(user.department), User.roles == 'TEAM_LEADER', User.is_deleted == False
+    ).first()
     if not leader:
         return jsonify({'error': 'Không tìm thấy trưởng nhóm cho phòng ban này'}), 400
     new_request = Request(
@@ -11389,7 +11490,7 @@ def approve_request(request_id):
     if action == 'approve':
         if req.step == 'leader':
             manager = User.query.filter(
-                User.department == req.user.department,
+                User.in_department(req.user.department),
                 User.roles.like('%MANAGER%'),
                 User.is_deleted == False
             ).first()
@@ -11532,6 +11633,33 @@ def get_attendance(attendance_id):
         'checkout_date': attendance.check_out.strftime('%d/%m/%Y') if attendance.check_out else attendance.date.strftime('%d/%m/%Y')
     })
 
+@app.route('/api/attendance/<int:attendance_id>/signatures', methods=['GET'])
+def get_attendance_signatures(attendance_id):
+    """Lấy ảnh chữ ký của MỘT bản ghi theo yêu cầu (danh sách lịch sử chỉ trả cờ has_*)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Không có quyền truy cập'}), 401
+    if check_session_timeout():
+        return jsonify({'error': 'Phiên đăng nhập đã hết hạn'}), 401
+    update_session_activity()
+    
+    has_permission, error_message = check_attendance_access_permission(session['user_id'], attendance_id, 'read')
+    if not has_permission:
+        return jsonify({'error': error_message}), 403
+    
+    # Chỉ đọc các cột chữ ký, không nạp toàn bộ bản ghi
+    row = db.session.query(
+        Attendance.signature, Attendance.team_leader_signature, Attendance.manager_signature
+    ).filter(Attendance.id == attendance_id).first()
+    if not row:
+        return jsonify({'error': 'Không tìm thấy bản ghi'}), 404
+    
+    return jsonify({
+        'id': attendance_id,
+        'signature': row.signature,
+        'team_leader_signature': row.team_leader_signature,
+        'manager_signature': row.manager_signature
+    })
+
 @app.route('/api/attendance/<int:attendance_id>', methods=['PUT'])
 def update_attendance(attendance_id):
     if 'user_id' not in session:
@@ -11902,15 +12030,10 @@ def clear_session_signature():
 @rate_limit(max_requests=200, window_seconds=60)
 def approve_attendance(attendance_id):
     """Phê duyệt chấm công - ĐÃ TỐI ƯU: Database commit trước, Google Sheet background"""
-    import sys
-    from datetime import datetime as dt
     
     # Log bắt đầu
-    timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
     try:
-        print(f"\n{'='*80}", flush=True, file=sys.stderr)
-        print(f"🚀 [APPROVE_START] {timestamp} - Bắt đầu phê duyệt attendance ID: {attendance_id}", flush=True, file=sys.stderr)
-        print(f"{'='*80}", flush=True, file=sys.stderr)
+        approval_log.debug("🚀 [APPROVE_START] Bắt đầu phê duyệt attendance ID: %s", attendance_id)
     except Exception:
         pass
     
@@ -12073,14 +12196,11 @@ def approve_attendance(attendance_id):
                     attendance.manager_signer_id = user.id
                 
                 # ===== CHUẨN BỊ DỮ LIỆU CHO GOOGLE SHEET =====
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 try:
-                    print(f"\n{'='*80}", flush=True, file=sys.stderr)
-                    print(f"🔵 [ADMIN_APPROVE] {timestamp} - ADMIN đang phê duyệt", flush=True, file=sys.stderr)
-                    print(f"   Attendance ID: {attendance_id}", flush=True, file=sys.stderr)
-                    print(f"   User: {attendance.user.name if attendance.user else 'Unknown'}", flush=True, file=sys.stderr)
-                    print(f"   Original Status: {original_status}", flush=True, file=sys.stderr)
-                    print(f"{'='*80}", flush=True, file=sys.stderr)
+                    approval_log.debug("🔵 [ADMIN_APPROVE] ADMIN đang phê duyệt")
+                    approval_log.debug("   Attendance ID: %s", attendance_id)
+                    approval_log.debug("   User: %s", (attendance.user.name if attendance.user else 'Unknown'))
+                    approval_log.debug("   Original Status: %s", original_status)
                 except Exception:
                     pass
                 
@@ -12088,7 +12208,7 @@ def approve_attendance(attendance_id):
                 if not attendance.user:
                     error_msg = "❌ Attendance không có thông tin user"
                     try:
-                        print(f"[VALIDATION_ERROR] {error_msg}", flush=True, file=sys.stderr)
+                        approval_log.error("[VALIDATION_ERROR] %s", error_msg)
                     except Exception:
                         pass
                     return jsonify({'error': error_msg}), 400
@@ -12100,7 +12220,7 @@ def approve_attendance(attendance_id):
                 if not employee_id:
                     employee_id = str(attendance.user.id) if attendance.user.id else attendance.user.name
                     try:
-                        print(f"⚠️ [FALLBACK] Sử dụng fallback employee_id: {employee_id}", flush=True, file=sys.stderr)
+                        approval_log.warning("⚠️ [FALLBACK] Sử dụng fallback employee_id: %s", employee_id)
                     except Exception:
                         pass
                 
@@ -12108,7 +12228,7 @@ def approve_attendance(attendance_id):
                 if not employee_team or employee_team == "Unknown":
                     employee_team = getattr(attendance.user, 'team', None) or "Unknown"
                     try:
-                        print(f"⚠️ [FALLBACK] Sử dụng fallback team: {employee_team}", flush=True, file=sys.stderr)
+                        approval_log.warning("⚠️ [FALLBACK] Sử dụng fallback team: %s", employee_team)
                     except Exception:
                         pass
                 
@@ -12208,7 +12328,7 @@ def approve_attendance(attendance_id):
                 
                 # ===== ĐỒNG BỘ CẬP NHẬT GOOGLE SHEET TRƯỚC KHI COMMIT DATABASE =====
                 try:
-                    print(f"🚀 [SYNC_SHEET_START] Bắt đầu cập nhật Google Sheet ĐỒNG BỘ...", flush=True, file=sys.stderr)
+                    approval_log.debug("🚀 [SYNC_SHEET_START] Bắt đầu cập nhật Google Sheet ĐỒNG BỘ...")
                 except Exception:
                     pass
                 
@@ -12222,8 +12342,8 @@ def approve_attendance(attendance_id):
                 if sheet_success:
                     # ===== GOOGLE SHEET THÀNH CÔNG - COMMIT AS APPROVED =====
                     try:
-                        print(f"✅ [SHEET_SUCCESS] Google Sheet cập nhật thành công!", flush=True, file=sys.stderr)
-                        print(f"💾 [DB_COMMIT] Đang commit database với status = 'approved'...", flush=True, file=sys.stderr)
+                        approval_log.info("✅ [SHEET_SUCCESS] Google Sheet cập nhật thành công!")
+                        approval_log.debug("💾 [DB_COMMIT] Đang commit database với status = 'approved'...")
                     except Exception:
                         pass
                     
@@ -12238,9 +12358,9 @@ def approve_attendance(attendance_id):
                 else:
                     # ===== GOOGLE SHEET THẤT BẠI - ROLLBACK TO pending_manager =====
                     try:
-                        print(f"❌ [SHEET_FAILED] Google Sheet cập nhật thất bại!", flush=True, file=sys.stderr)
-                        print(f"   Error: {sheet_error}", flush=True, file=sys.stderr)
-                        print(f"🔄 [ROLLBACK] Keeping status as '{original_status}'...", flush=True, file=sys.stderr)
+                        approval_log.error("❌ [SHEET_FAILED] Google Sheet cập nhật thất bại!")
+                        approval_log.error("   Error: %s", sheet_error)
+                        approval_log.debug("🔄 [ROLLBACK] Keeping status as '%s'...", original_status)
                     except Exception:
                         pass
                     
@@ -12257,16 +12377,14 @@ def approve_attendance(attendance_id):
                     # Commit the rollback state
                     try:
                         db.session.commit()
-                        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                         try:
-                            print(f"💾 [ROLLBACK_COMMIT] {timestamp} - Database rolled back to '{attendance.status}'", flush=True, file=sys.stderr)
-                            print(f"{'='*80}\n", flush=True, file=sys.stderr)
+                            approval_log.debug("💾 [ROLLBACK_COMMIT] Database rolled back to '%s'", attendance.status)
                         except Exception:
                             pass
                     except Exception as commit_error:
                         db.session.rollback()
                         try:
-                            print(f"❌ [ROLLBACK_ERROR] Lỗi commit rollback: {str(commit_error)}", flush=True, file=sys.stderr)
+                            approval_log.error("❌ [ROLLBACK_ERROR] Lỗi commit rollback: %s", str(commit_error))
                         except Exception:
                             pass
                         return jsonify({'error': 'Lỗi lưu database'}), 500
@@ -12280,9 +12398,8 @@ def approve_attendance(attendance_id):
                         'message': f'Bản ghi vẫn ở trạng thái "{original_status}". Vui lòng khắc phục lỗi và thử phê duyệt lại.'
                     }
                     try:
-                        print(f"📤 [ERROR_RESPONSE] Trả về lỗi cho client", flush=True, file=sys.stderr)
-                        print(f"   Status được giữ: {attendance.status}", flush=True, file=sys.stderr)
-                        print(f"{'='*80}\n", flush=True, file=sys.stderr)
+                        approval_log.debug("📤 [ERROR_RESPONSE] Trả về lỗi cho client")
+                        approval_log.debug("   Status được giữ: %s", attendance.status)
                     except Exception:
                         pass
                     
@@ -12332,28 +12449,23 @@ def approve_attendance(attendance_id):
         if current_role in ['TEAM_LEADER', 'MANAGER']:
             try:
                 db.session.commit()
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 try:
-                    print(f"✅ [{current_role}_COMMIT] {timestamp} - Database committed", flush=True, file=sys.stderr)
+                    approval_log.info("✅ [%s_COMMIT] Database committed", current_role)
                 except Exception:
                     pass
             except Exception as e:
                 db.session.rollback()
-                timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
                 try:
-                    print(f"❌ [{current_role}_COMMIT_ERROR] {timestamp} - Error: {e}", flush=True, file=sys.stderr)
+                    approval_log.error("❌ [%s_COMMIT_ERROR] Error: %s", current_role, e)
                 except Exception:
                     pass
                 return jsonify({'error': 'Lỗi lưu database'}), 500
         
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         try:
-            print(f"\n{'='*80}", flush=True, file=sys.stderr)
-            print(f"✅ [APPROVE_SUCCESS] {timestamp} - Phê duyệt thành công!", flush=True, file=sys.stderr)
-            print(f"   User: {user.name} ({current_role})", flush=True, file=sys.stderr)
-            print(f"   Attendance ID: {attendance_id}", flush=True, file=sys.stderr)
-            print(f"   New Status: {attendance.status}", flush=True, file=sys.stderr)
-            print(f"{'='*80}\n", flush=True, file=sys.stderr)
+            approval_log.info("✅ [APPROVE_SUCCESS] Phê duyệt thành công!")
+            approval_log.debug("   User: %s (%s)", user.name, current_role)
+            approval_log.debug("   Attendance ID: %s", attendance_id)
+            approval_log.debug("   New Status: %s", attendance.status)
         except Exception:
             pass
         
@@ -12361,34 +12473,29 @@ def approve_attendance(attendance_id):
         
     except ValidationError as ve:
         db.session.rollback()
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         try:
-            print(f"❌ [VALIDATION_ERROR] {timestamp} - {ve.message}", flush=True, file=sys.stderr)
+            approval_log.error("❌ [VALIDATION_ERROR] %s", ve.message)
         except Exception:
             pass
         return jsonify({'error': ve.message}), 400
         
     except SQLAlchemyError as se:
         db.session.rollback()
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         try:
-            print(f"❌ [DB_ERROR] {timestamp} - {str(se)}", flush=True, file=sys.stderr)
+            approval_log.error("❌ [DB_ERROR] %s", str(se))
         except Exception:
             pass
         return jsonify({'error': 'Lỗi cơ sở dữ liệu'}), 500
         
     except Exception as e:
         db.session.rollback()
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         try:
             import traceback
-            print(f"\n{'='*80}", flush=True, file=sys.stderr)
-            print(f"❌ [APPROVE_ERROR] {timestamp} - Lỗi không mong muốn", flush=True, file=sys.stderr)
-            print(f"   Error: {str(e)}", flush=True, file=sys.stderr)
-            print(f"   Type: {type(e).__name__}", flush=True, file=sys.stderr)
-            print(f"   Traceback:", flush=True, file=sys.stderr)
-            print(traceback.format_exc(), flush=True, file=sys.stderr)
-            print(f"{'='*80}\n", flush=True, file=sys.stderr)
+            approval_log.error("❌ [APPROVE_ERROR] Lỗi không mong muốn")
+            approval_log.error("   Error: %s", str(e))
+            approval_log.error("   Type: %s", type(e).__name__)
+            approval_log.error("   Traceback:")
+            approval_log.error("%s", traceback.format_exc())
         except Exception:
             pass
         return jsonify({'error': f'Lỗi hệ thống: {str(e)}'}), 500
@@ -12479,15 +12586,29 @@ def get_pending_attendance():
     from utils.query_optimizer import optimize_pending_attendance_query
     
     # Debug logging để kiểm tra vấn đề
-    print(f"🔍 [PENDING_API] User: {user.name}, ID: {user.id}", flush=True)
-    print(f"🔍 [PENDING_API] Role: {current_role}, Department: [{user.department}]", flush=True)
-    
-    records, total = optimize_pending_attendance_query(
-        current_role=current_role, user=user, search=search, department=department,
-        date_from=date_from, date_to=date_to, page=page, per_page=per_page
-    )
+    approval_log.debug("🔍 [PENDING_API] User: %s, ID: %s", user.name, user.id)
+    approval_log.debug("🔍 [PENDING_API] Role: %s, Department: [%s]", current_role, user.department)
+    
+    # Phân trang keyset khi client gửi ?cursor= (rỗng = trang đầu); không có thì dùng page/offset như cũ
+    cursor = request.args.get('cursor')
+    include_total = request.args.get('include_total', '1') != '0'
+    page_info = None
+    if cursor is not None:
+        try:
+            records, total, page_info = optimize_pending_attendance_query(
+                current_role=current_role, user=user, search=search, department=department,
+                date_from=date_from, date_to=date_to, per_page=per_page,
+                cursor=cursor, include_total=include_total
+            )
+        except ValueError:
+            return jsonify({'error': 'Cursor phân trang không hợp lệ'}), 400
+    else:
+        records, total = optimize_pending_attendance_query(
+            current_role=current_role, user=user, search=search, department=department,
+            date_from=date_from, date_to=date_to, page=page, per_page=per_page
+        )
     
-    print(f"🔍 [PENDING_API] Found {total} records for role {current_role}", flush=True)
+    approval_log.debug("🔍 [PENDING_API] Found %s records for role %s", total, current_role)
     
     result = []
     for att in records:
@@ -12516,13 +12637,16 @@ def get_pending_attendance():
             'team_leader_signature': att.team_leader_signature,
             'manager_signature': att.manager_signature
         })
-    resp = jsonify({
+    response_data = {
         'total': total,
         'page': page,
         'per_page': per_page,
         'data': result,
         'freshness': freshness  # Include real-time freshness data
-    })
+    }
+    if page_info is not None:
+        response_data.update(page_info)
+    resp = jsonify(response_data)
     # Disable caching to ensure fresh data after role switch
     resp.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     resp.headers['Pragma'] = 'no-cache'
@@ -12591,7 +12715,7 @@ def debug_team_leader_attendance():
         'name': user.name,
         'employee_id': user.employee_id,
         'department': user.department,
-        'department_upper': (user.department or '').strip().upper(),
+        'department_upper': normalize_department(user.department),
         'role': current_role
     }
     
@@ -12600,7 +12724,7 @@ def debug_team_leader_attendance():
         User.is_deleted == False
     ).group_by(User.department).all()
     
-    dept_list = [{'name': d[0], 'upper': (d[0] or '').strip().upper(), 'count': d[1]} for d in all_departments]
+    dept_list = [{'name': d[0], 'upper': normalize_department(d[0]), 'count': d[1]} for d in all_departments]
     
     # Tìm nhân viên cùng phòng ban (exact match)
     user_dept = user.department
@@ -12610,9 +12734,9 @@ def debug_team_leader_attendance():
     ).all()
     
     # Tìm nhân viên cùng phòng ban (case-insensitive)
-    user_dept_upper = (user.department or '').strip().upper()
+    user_dept_upper = normalize_department(user.department)
     case_insensitive_employees = User.query.filter(
-        func.upper(func.trim(User.department)) == user_dept_upper,
+        User.in_department(user.department),
         User.is_deleted == False
     ).all()
     
@@ -12627,11 +12751,11 @@ def debug_team_leader_attendance():
             'user_id': att.user_id,
             'user_name': emp.name if emp else 'Unknown',
             'user_dept': emp.department if emp else 'Unknown',
-            'user_dept_upper': (emp.department or '').strip().upper() if emp else 'Unknown',
+            'user_dept_upper': normalize_department(emp.department) if emp else 'Unknown',
             'date': att.date.strftime('%Y-%m-%d'),
             'status': att.status,
             'matches_exact': (emp.department == user_dept) if emp else False,
-            'matches_case_insensitive': ((emp.department or '').strip().upper() == user_dept_upper) if emp else False
+            'matches_case_insensitive': (normalize_department(emp.department) == user_dept_upper) if emp else False
         })
     
     # Lấy pending attendance của nhân viên cùng phòng ban (case-insensitive)
@@ -14353,9 +14477,9 @@ def export_overtime_pdf(attendance_id):
         return send_file(buffer, as_attachment=True, download_name=filename, mimetype='application/pdf')
         
     except Exception as e:
-        print('PDF export error:', e)
+        export_log.debug("PDF export error: %s", e)
         import traceback
-        print(traceback.format_exc())
+        export_log.error("%s", traceback.format_exc())
         return jsonify({'error': 'Lỗi khi sinh file PDF', 'detail': str(e)})
 
 @app.route('/admin/attendance/<int:attendance_id>/test-signature-pdf')
@@ -14443,23 +14567,34 @@ def create_sample_signature_base64():
         # Trả về chữ ký mẫu đơn giản nếu có lỗi
         return "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
 
-# Hàm wrap_text cho phần ghi chú (đặt phía trên đoạn sử dụng)
-def wrap_text(text, font_name, font_size, max_width, canvas_obj):
-    from reportlab.pdfbase.pdfmetrics import stringWidth
-    words = text.split(' ')
-    lines = []
-    current_line = ''
-    for word in words:
-        test_line = current_line + (' ' if current_line else '') + word
-        if stringWidth(test_line, font_name, font_size) <= max_width:
-            current_line = test_line
-        else:
-            if current_line:
-                lines.append(current_line)
-            current_line = word
-    if current_line:
-        lines.append(current_line)
-    return lines
+# Renderer PDF tăng ca hàng loạt (process pool + cache đĩa), khởi tạo khi export lần đầu
+_overtime_pdf_renderer = None
+_overtime_pdf_renderer_lock = threading.Lock()
+
+def _get_overtime_pdf_renderer():
+    global _overtime_pdf_renderer
+    with _overtime_pdf_renderer_lock:
+        if _overtime_pdf_renderer is None:
+            # Worker (spawn) chỉ import utils.overtime_pdf; key giải mã chữ ký Fernet đi qua initializer của pool
+            renderer_kwargs = dict(initializer=init_render_worker,
+                                   initargs=(app.config.get('SIGNATURE_SECRET_KEY'),))
+            if __name__ == '__main__':
+                # python app.py: spawn chạy lại app.py (__main__) trong mỗi worker -> render ngay trong process
+                renderer_kwargs['max_workers'] = 1
+            _overtime_pdf_renderer = BulkPdfRenderer(create_overtime_pdf, **renderer_kwargs)
+        return _overtime_pdf_renderer
+
+def _load_overtime_pdf_records(attendance_ids, report_session=None):
+    """Nạp đầy đủ bản ghi cần render (kèm người ký) và tách khỏi session để gửi sang worker"""
+    report_session = report_session or db.session
+    records = Attendance.query.with_session(report_session).filter(Attendance.id.in_(attendance_ids)).options(
+        joinedload(Attendance.user),
+        joinedload(Attendance.team_leader_signer),
+        joinedload(Attendance.manager_signer)
+    ).all()
+    for record in records:
+        report_session.expunge(record)
+    return {record.id: record for record in records}
 
 @app.route('/admin/attendance/export-overtime-bulk')
 @require_admin
@@ -14472,6 +14607,7 @@ def export_overtime_bulk():
     - Theo khoảng ngày: date_from, date_to
     - Theo khoảng tháng/năm: month_from, year_from, month_to, year_to
     """
+    report = None
     try:
         # Tham số cũ (giữ để tương thích)
         month = request.args.get('month')  # Có thể None nếu xuất theo năm
@@ -14551,92 +14687,66 @@ def export_overtime_bulk():
                     return abort(400, 'Tham số tháng không hợp lệ')
                 query_filter.append(db.extract('month', Attendance.date) == month)
 
-        # Lấy tất cả bản ghi Attendance đã được phê duyệt
-        # Tối ưu: chỉ lấy các trường cần thiết
-        attendances = Attendance.query.filter(*query_filter).options(
-            joinedload(Attendance.user).load_only(User.name, User.employee_id, User.department)
-        ).all()
+        # Chỉ lấy khoá cache + thông tin đặt tên file; bản ghi đầy đủ (kèm chữ ký) chỉ nạp khi cần render.
+        # Đọc từ snapshot báo cáo (nếu bật); session được đóng khi ZIP stream xong
+        report = open_report_session(fresh=_wants_fresh_report())
+        rows = report.session.query(
+            Attendance.id, Attendance.version, Attendance.updated_at, Attendance.date,
+            User.name, User.employee_id
+        ).outerjoin(User, User.id == Attendance.user_id).filter(*query_filter).order_by(Attendance.id).all()
+
+        if not rows:
+            report.close()
+            return report.apply_headers(jsonify({'error': 'Không có dữ liệu trong khoảng đã chọn để tạo ZIP.', 'detail': 'Không có bản ghi nào trong khoảng đã chọn'})), 404
+        
+        entries = []
+        for att_id, version, updated_at, att_date, user_name, employee_id in rows:
+            # Đặt tên file cho từng PDF (loại bỏ dấu tiếng Việt)
+            safe_name = remove_vietnamese_accents(user_name) if user_name else str(att_id)
+            safe_empid = str(employee_id) if employee_id else str(att_id)
+            safe_date = att_date.strftime('%d%m%Y')
+            entries.append(BulkPdfEntry(att_id, version, updated_at, f"tangca_{safe_name}_{safe_empid}_{safe_date}.pdf"))
+
+        export_log.debug("Creating ZIP for %s records...", len(entries))
+        renderer = _get_overtime_pdf_renderer()
+
+        def load_records(attendance_ids):
+            return _load_overtime_pdf_records(attendance_ids, report.session)
+
+        def generate_zip():
+            def rendered_files():
+                for i, (entry, path) in enumerate(renderer.iter_rendered(entries, load_records), 1):
+                    if path is None:
+                        export_log.error("Error creating PDF for attendance %s", entry.attendance_id)
+                        continue
+                    # Log progress mỗi 50 records
+                    if i % 50 == 0:
+                        export_log.debug("Processed %s/%s records...", i, len(entries))
+                    yield entry.arcname, path
 
-        if not attendances:
-            return jsonify({'error': 'Không có dữ liệu trong khoảng đã chọn để tạo ZIP.', 'detail': 'Không có bản ghi nào trong khoảng đã chọn'}), 404
-        
-        print(f'Creating ZIP for {len(attendances)} records...')
-        
-        # Tạo file ZIP trong bộ nhớ với compression level cao hơn
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
-            for i, att in enumerate(attendances, 1):
-                try:
-                    # Tạo PDF cho từng bản ghi
-                    pdf_buffer = io.BytesIO()
-                    
-                    # Gọi hàm tạo PDF (tái sử dụng logic từ export_overtime_pdf)
-                    create_overtime_pdf(att, pdf_buffer)
-                    
-                    # Đặt tên file cho từng PDF (loại bỏ dấu tiếng Việt)
-                    
-                    safe_name = remove_vietnamese_accents(att.user.name) if att.user and att.user.name else str(att.id)
-                    safe_empid = str(att.user.employee_id) if att.user and att.user.employee_id else str(att.id)
-                    safe_date = att.date.strftime('%d%m%Y')
-                    filename = f"tangca_{safe_name}_{safe_empid}_{safe_date}.pdf"
-                    
-                    # Đảm bảo buffer ở đầu file
-                    pdf_buffer.seek(0)
-                    zipf.writestr(filename, pdf_buffer.read())
-                    
-                    # Log progress mỗi 10 records
-                    if i % 10 == 0:
-                        print(f'Processed {i}/{len(attendances)} records...')
-                    
-                except Exception as e:
-                    print(f'Error creating PDF for attendance {att.id}: {e}')
-                    continue
-        
-        zip_buffer.seek(0)
+            try:
+                yield from stream_zip(rendered_files())
+                export_log.debug("ZIP creation completed: %s (%s)", zip_filename, renderer.stats())
+            finally:
+                report.close()
         
         # Tạo tên file ZIP theo ngày xuất (áp dụng cho mọi loại khoảng)
         from datetime import datetime as _dt
         zip_filename = f"tangca_bulk_{_dt.now().strftime('%Y%m%d')}.zip"
-            
-        print(f'ZIP creation completed: {zip_filename}')
-        return send_file(zip_buffer, as_attachment=True, download_name=zip_filename, mimetype='application/zip')
+
+        from flask import Response, stream_with_context
+        response = Response(stream_with_context(generate_zip()), mimetype='application/zip')
+        response.headers['Content-Disposition'] = f'attachment; filename="{zip_filename}"'
+        # Client ngắt trước khi đọc body -> generator không chạy tới finally; server đóng response thì vẫn đóng session
+        response.call_on_close(report.close)
+        return report.apply_headers(response)
         
     except Exception as e:
-        print('Bulk export error:', e)
+        export_log.debug("Bulk export error: %s", e)
+        if report is not None:
+            report.close()
         return jsonify({'error': 'Lỗi khi xuất file ZIP', 'detail': str(e)})
 
-# Cache fonts để tránh đăng ký lại mỗi lần
-_fonts_registered = False
-
-def register_pdf_fonts():
-    """Đăng ký fonts cho PDF một lần duy nhất"""
-    global _fonts_registered
-    if _fonts_registered:
-        return
-    
-    try:
-        # Thử đăng ký DejaVuSans cho tiếng Việt
-        registerFont(TTFont('DejaVuSans', 'static/fonts/DejaVuSans.ttf'))
-        registerFont(TTFont('DejaVuSans-Bold', 'static/fonts/DejaVuSans.ttf'))  # Sử dụng cùng font cho bold
-        
-        # Đăng ký NotoSansJP cho tiếng Nhật
-        registerFont(TTFont('NotoSansJP', 'static/fonts/NotoSansJP-Regular.ttf'))
-        registerFont(TTFont('NotoSansJP-Bold', 'static/fonts/NotoSansJP-Bold.ttf'))
-        registerFont(TTFont('NotoSansJP-Medium', 'static/fonts/NotoSansJP-Medium.ttf'))
-        registerFont(TTFont('NotoSansJP-Light', 'static/fonts/NotoSansJP-Light.ttf'))
-        registerFont(TTFont('NotoSansJP-Black', 'static/fonts/NotoSansJP-Black.ttf'))
-        registerFont(TTFont('NotoSansJP-ExtraBold', 'static/fonts/NotoSansJP-ExtraBold.ttf'))
-        registerFont(TTFont('NotoSansJP-ExtraLight', 'static/fonts/NotoSansJP-ExtraLight.ttf'))
-        registerFont(TTFont('NotoSansJP-SemiBold', 'static/fonts/NotoSansJP-SemiBold.ttf'))
-        registerFont(TTFont('NotoSansJP-Thin', 'static/fonts/NotoSansJP-Thin.ttf'))
-        
-        _fonts_registered = True
-        print('PDF fonts registered successfully')
-    except Exception as e:
-        print('PDF font register error:', e)
-        # Fallback: sử dụng font mặc định
-        _fonts_registered = True
-
 def fix_base64_padding(base64_string):
     """
     Sửa lỗi base64 padding để đảm bảo độ dài là bội số của 4
@@ -14807,581 +14917,6 @@ def process_signature_for_pdf(signature_data):
         traceback.print_exc()
         return None
 
-def draw_signature_with_proper_scaling(canvas, signature_data, x, y, box_width, box_height):
-    """
-    Vẽ chữ ký với tỷ lệ đúng và màu xanh như bút bi - SỬ DỤNG SIGNATURE FIT ADAPTER
-    """
-    if not signature_data:
-        print("DEBUG: No signature data provided to draw")
-        return False
-    
-    try:
-        # Sử dụng signature fit adapter để điều chỉnh chữ ký vừa khít với ô
-        from utils.signature_manager import signature_manager
-        
-        # Xác định loại ô dựa trên kích thước
-        box_type = 'default'
-        if box_width >= 140 and box_height >= 70:
-            box_type = 'manager'  # Ô quản lý
-        elif box_width >= 120 and box_height >= 60:
-            box_type = 'supervisor'  # Ô cấp trên
-        elif box_width >= 100 and box_height >= 50:
-            box_type = 'applicant'  # Ô người xin phép
-        
-        print(f"DEBUG: Using signature fit adapter for box type: {box_type}")
-        
-        # Điều chỉnh chữ ký vừa khít với ô
-        fitted_signature = signature_manager.fit_signature_to_form_box(
-            signature_data, 
-            box_type=box_type
-        )
-        
-        if not fitted_signature:
-            print("DEBUG: Failed to fit signature to box")
-            return False
-                
-        print(f"DEBUG: Fitted signature length: {len(fitted_signature)}")
-        
-        # Decode base64
-        try:
-            if fitted_signature.startswith('data:image'):
-                fitted_signature = fitted_signature.split(',')[1]
-            
-            decoded_data = base64.b64decode(fitted_signature)
-            print(f"DEBUG: Successfully decoded fitted signature, length: {len(decoded_data)}")
-            
-        except Exception as decode_error:
-            print(f"DEBUG: Failed to decode fitted signature: {decode_error}")
-            return False
-        
-        # Mở và chuẩn hóa ảnh, đồng thời chuẩn bị để nội suy theo kích thước vẽ thực tế
-        try:
-            from PIL import Image
-            import io
-            
-            pil_image = Image.open(io.BytesIO(decoded_data))
-            if pil_image.mode != 'RGBA':
-                pil_image = pil_image.convert('RGBA')
-        except Exception as img_open_err:
-            print(f"DEBUG: Failed to open image for processing: {img_open_err}")
-            return False
-        
-        # Tính tỷ lệ để giữ nguyên tỷ lệ khung hình và vừa khít với ô
-        img_width, img_height = pil_image.size
-        print(f"DEBUG: Fitted image size (PIL): {img_width}x{img_height}")
-        aspect_ratio = img_width / img_height
-        box_aspect_ratio = box_width / box_height
-        
-        # Tính kích thước thực tế để vẽ - TĂNG FILL RATIO ĐỂ CHỮ KÝ LỚN HƠN KHI IN
-        # Điều chỉnh động dựa trên kích thước chữ ký gốc
-        fill_ratio = 0.96  # Tăng từ 92% lên 96% để chữ ký lớn hơn khi in
-        
-        # Kiểm tra kích thước chữ ký đã được fit
-        # Nếu chữ ký đã được fit đúng kích thước ô, sử dụng trực tiếp
-        if abs(img_width - box_width) < box_width * 0.1 and abs(img_height - box_height) < box_height * 0.1:
-            # Chữ ký đã được fit gần đúng kích thước ô, sử dụng fill_ratio
-            draw_width = box_width * fill_ratio
-            draw_height = box_height * fill_ratio
-        else:
-            # Chữ ký chưa được fit, tính toán lại để fill tốt
-            if aspect_ratio > box_aspect_ratio:
-                # Ảnh rộng hơn, căn theo chiều rộng
-                draw_width = box_width * fill_ratio
-                draw_height = draw_width / aspect_ratio
-            else:
-                # Ảnh cao hơn, căn theo chiều cao
-                draw_height = box_height * fill_ratio
-                draw_width = draw_height * aspect_ratio
-            
-            # Đảm bảo không vượt quá kích thước ô
-            if draw_width > box_width:
-                draw_width = box_width * fill_ratio
-                draw_height = draw_width / aspect_ratio
-            if draw_height > box_height:
-                draw_height = box_height * fill_ratio
-                draw_width = draw_height * aspect_ratio
-            
-            # Đảm bảo fill tối thiểu 80% nếu chữ ký quá nhỏ
-            min_fill = 0.80
-            if draw_width < box_width * min_fill or draw_height < box_height * min_fill:
-                # Scale lên để đạt min_fill
-                width_scale = (box_width * min_fill) / draw_width if draw_width < box_width * min_fill else 1.0
-                height_scale = (box_height * min_fill) / draw_height if draw_height < box_height * min_fill else 1.0
-                scale_factor = min(width_scale, height_scale)
-                draw_width = draw_width * scale_factor
-                draw_height = draw_height * scale_factor
-                
-                # Đảm bảo không vượt quá fill_ratio sau khi scale
-                if draw_width > box_width * fill_ratio:
-                    draw_width = box_width * fill_ratio
-                    draw_height = draw_width / aspect_ratio
-                if draw_height > box_height * fill_ratio:
-                    draw_height = box_height * fill_ratio
-                    draw_width = draw_height * aspect_ratio
-        
-        # Kiểm tra kích thước vẽ hợp lệ
-        if draw_width <= 0 or draw_height <= 0:
-            print(f"DEBUG: Invalid draw dimensions: {draw_width}x{draw_height}")
-            return False
-        
-        # Nội suy ảnh tới độ phân giải mục tiêu dựa trên kích thước vẽ để luôn sắc nét
-        try:
-            target_dpi = 300  # Tăng từ 220 lên 300 DPI để chữ ký sắc nét hơn khi in
-            target_px_w = max(1, int(draw_width * target_dpi / 72.0))
-            target_px_h = max(1, int(draw_height * target_dpi / 72.0))
-            
-            if pil_image.size != (target_px_w, target_px_h):
-                pil_image = pil_image.resize((target_px_w, target_px_h), Image.Resampling.LANCZOS)
-            
-            # Chuyển màu chữ ký sang xanh bút bi sau khi đã resize để giữ cạnh mịn
-            data = pil_image.getdata()
-            blue_pen_color = (0, 0, 255, 255)
-            new_data = []
-            for item in data:
-                if item[0] < 50 and item[1] < 50 and item[2] < 50 and item[3] > 100:
-                    new_data.append(blue_pen_color)
-                else:
-                    new_data.append(item)
-            new_image = Image.new('RGBA', pil_image.size)
-            new_image.putdata(new_data)
-            
-            new_image_buffer = io.BytesIO()
-            new_image.save(new_image_buffer, format='PNG')
-            new_image_buffer.seek(0)
-            img = ImageReader(new_image_buffer)
-            print("DEBUG: Image prepared and ImageReader created at target DPI")
-        except Exception as prep_err:
-            print(f"DEBUG: Failed to prepare high-DPI image: {prep_err}")
-            try:
-                img = ImageReader(io.BytesIO(decoded_data))
-            except Exception:
-                return False
-        
-        # Tính vị trí căn giữa
-        x_offset = (box_width - draw_width) / 2
-        y_offset = (box_height - draw_height) / 2
-        
-        # Vẽ nền trắng cho ô chữ ký để tránh bị đen
-        canvas.setFillColor(colors.white)
-        canvas.rect(x, y, box_width, box_height, fill=1, stroke=0)
-        canvas.setFillColor(colors.black)  # Reset về màu đen cho text
-        
-        # Vẽ chữ ký với kích thước đã tính toán
-        try:
-            final_x = x + x_offset
-            final_y = y + y_offset
-            
-            # Kiểm tra vị trí hợp lệ
-            if final_x < 0 or final_y < 0:
-                print(f"DEBUG: Invalid position: ({final_x}, {final_y})")
-                return False
-                
-            # Kiểm tra vị trí có vượt quá trang không
-            if final_x + draw_width > canvas._pagesize[0] or final_y + draw_height > canvas._pagesize[1]:
-                print(f"DEBUG: Position out of page bounds")
-                return False
-            
-            canvas.drawImage(img, final_x, final_y, width=draw_width, height=draw_height)
-            print(f"DEBUG: Blue signature drawn successfully with signature fit adapter")
-            print(f"DEBUG: Fitted size: {img_width}x{img_height}, Draw size: {draw_width:.1f}x{draw_height:.1f}")
-            print(f"DEBUG: Position: ({final_x:.1f}, {final_y:.1f})")
-            return True
-        except Exception as draw_error:
-            print(f"DEBUG: Failed to draw image: {draw_error}")
-            import traceback
-            traceback.print_exc()
-            return False
-        
-    except Exception as e:
-        print(f"DEBUG: Error drawing signature with signature fit adapter: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
-
-def create_signature_placeholder(canvas, x, y, box_width, box_height, text="Chữ ký"):
-    """Tạo placeholder cho chữ ký khi không thể hiển thị"""
-    try:
-        # Vẽ nền trắng
-        canvas.setFillColor(colors.white)
-        canvas.rect(x, y, box_width, box_height, fill=1, stroke=0)
-        
-        # Vẽ border
-        canvas.setStrokeColor(colors.grey)
-        canvas.setLineWidth(0.5)
-        canvas.rect(x, y, box_width, box_height, stroke=1, fill=0)
-        
-        # Vẽ text placeholder
-        canvas.setFillColor(colors.grey)
-        canvas.setFont("DejaVuSans", 8)
-        
-        # Căn giữa text
-        text_width = canvas.stringWidth(text, "DejaVuSans", 8)
-        text_x = x + (box_width - text_width) / 2
-        text_y = y + box_height / 2 + 3  # +3 để căn giữa theo chiều dọc
-        
-        canvas.drawString(text_x, text_y, text)
-        
-        # Reset màu
-        canvas.setFillColor(colors.black)
-        canvas.setStrokeColor(colors.black)
-        
-        return True
-    except Exception as e:
-        print(f"DEBUG: Error creating signature placeholder: {e}")
-        return False
-
-def create_overtime_pdf(attendance, buffer):
-    """Tạo PDF giấy tăng ca cho một bản ghi attendance"""
-    # Đăng ký fonts một lần duy nhất
-    register_pdf_fonts()
-    
-    user = attendance.user
-    employee_signature = attendance.signature if attendance.signature else None
-    team_leader_signature = attendance.team_leader_signature if attendance.team_leader_signature else None
-    manager_signature = attendance.manager_signature if attendance.manager_signature else None
-    
-    # Lấy thông tin người ký từ database
-    from database.models import User
-    
-    # Thông tin người ký employee (người tạo đơn)
-    employee_signer_name = user.name if user else "Không xác định"
-    
-    # Thông tin người ký team leader và manager - load relationship và xử lý an toàn
-    team_leader_signer_name = "Chưa ký"
-    manager_signer_name = "Chưa ký"
-    
-    # Kiểm tra và lấy tên người ký team leader
-    if hasattr(attendance, 'team_leader_signer') and attendance.team_leader_signer:
-        team_leader_signer_name = attendance.team_leader_signer.name
-    elif hasattr(attendance, 'team_leader_signer_id') and attendance.team_leader_signer_id:
-        # Nếu có ID nhưng relationship chưa load, query trực tiếp
-        team_leader = db.session.get(User, attendance.team_leader_signer_id)
-        if team_leader:
-            team_leader_signer_name = team_leader.name
-    
-    # Kiểm tra và lấy tên người ký manager
-    if hasattr(attendance, 'manager_signer') and attendance.manager_signer:
-        manager_signer_name = attendance.manager_signer.name
-    elif hasattr(attendance, 'manager_signer_id') and attendance.manager_signer_id:
-        # Nếu có ID nhưng relationship chưa load, query trực tiếp
-        manager = db.session.get(User, attendance.manager_signer_id)
-        if manager:
-            manager_signer_name = manager.name
-    
-
-
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    margin = 30
-    y = height - margin
-
-    # Header: Bảng 6 cột như trong hình
-    header_data = [
-        [
-            Paragraph('<b>DMI HUẾ</b>', ParagraphStyle('h', fontName='DejaVuSans', fontSize=9, alignment=1)),
-            Paragraph('<b>総務<br/>TỔNG VỤ</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=8, alignment=1)),
-            Paragraph('<b>分類番号：<br/>Số hiệu phân loại：</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=7, alignment=1)),
-            Paragraph('', ParagraphStyle('h', fontName='DejaVuSans', fontSize=8, alignment=1)),  # Ô trắng sau ô 3
-            Paragraph('<b>記入 FORM<br/>NHẬP FORM</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=8, alignment=1)),
-            Paragraph('<b>Form作成：<br/>Tác thành：</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=7, alignment=1)),
-            Paragraph('', ParagraphStyle('h', fontName='DejaVuSans', fontSize=8, alignment=1)),  # Ô trắng sau ô tác thành
-            Paragraph('', ParagraphStyle('h', fontName='DejaVuSans', fontSize=8, alignment=1)),  # Ô trắng thứ 2 sau ô tác thành
-        ]
-    ]
-    
-    col_widths = [60, 80, 100, 50, 80, 80, 50, 50]  # Tổng = 570, gần bằng width A4
-    header_table_width = sum(col_widths)
-    x_header = (width - header_table_width) / 2
-    header_table = Table(header_data, colWidths=col_widths, rowHeights=25)
-    header_table.setStyle(TableStyle([
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('BOX', (0,0), (-1,-1), 0.5, colors.black),
-        ('INNERGRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('FONTNAME', (0,0), (-1,-1), 'DejaVuSans'),
-    ]))
-    header_table.wrapOn(c, width-2*margin, 30)
-    header_table.drawOn(c, x_header, y-25)
-    y -= 40
-
-    # Thông tin công ty
-    c.setFont("DejaVuSans", 10)
-    c.drawString(margin, y, "Công ty TNHH DMI HUẾ")
-    y -= 12
-    c.setFont("DejaVuSans", 8)
-    c.drawString(margin, y, "174 Bà Triệu- tòa nhà 4 tầng Phong Phú Plaza, phường Phú Hội, Thành phố Huế, Tỉnh Thừa Thiên Huế,Việt Nam.")
-    y -= 25
-
-    # Tiêu đề chính
-    c.setFont("DejaVuSans", 14)
-    c.drawCentredString(width/2, y, "GIẤY ĐỀ NGHỊ TĂNG CA/ĐI LÀM NGÀY NGHỈ")
-    y -= 16
-    c.setFont("NotoSansJP", 11)
-    c.drawCentredString(width/2, y, "(残業/休日出勤申請書)")
-    y -= 20
-    c.setFont("DejaVuSans", 9)
-    c.drawCentredString(width/2, y, "Nộp tại bộ phận tổng vụ")
-    c.setFont("NotoSansJP-Light", 9)
-    c.drawCentredString(width/2, y-10, "(総務部署で提出)")
-    y -= 30
-
-    # Phần checkbox và thông tin cá nhân
-    c.setFont("DejaVuSans", 10)
-    
-    # Dòng checkbox
-    checkbox_y = y
-    c.rect(margin, checkbox_y-3, 8, 8)  # Checkbox tăng ca
-    c.drawString(margin+15, checkbox_y, "Tăng ca /")
-    c.setFont("NotoSansJP", 10)
-    c.drawString(margin+70, checkbox_y, "残業")
-    
-    c.rect(margin+200, checkbox_y-3, 8, 8)  # Checkbox đi làm ngày nghỉ
-    c.setFont("DejaVuSans", 10)
-    c.drawString(margin+215, checkbox_y, "Đi làm ngày nghỉ /")
-    c.setFont("NotoSansJP", 10)
-    c.drawString(margin+320, checkbox_y, "休日出勤")
-    y -= 20
-
-    # Thông tin nhân viên
-    c.setFont("NotoSansJP-Light", 10)
-    c.drawString(margin, y, f"Họ tên (氏名)：{user.name}")
-    c.drawString(margin+200, y, f"Nhóm (チーム)：{user.department}")
-    c.drawString(margin+350, y, f"Mã NV (社員コード): {user.employee_id}")
-    y -= 15
-    
-    c.drawString(margin, y, f"Lý do tăng ca (理由): {attendance.note}")
-    y -= 15
-    
-    c.drawString(margin, y, "Đề nghị công ty chấp thuận cho tôi được tăng ca/đi làm vào ngày nghỉ.")
-    y -= 10
-    c.setFont("NotoSansJP-Light", 9)
-    c.drawString(margin, y, "残業/休日出勤を許可お願いします。")
-    y -= 25
-    
-    # Thêm khoảng cách trước khi vẽ bảng thời gian
-    y -= 15
-
-    # Bảng chấm công chi tiết
-    table_y = y
-    table_width = width - 2*margin
-    
-    # Định nghĩa style cho tiêu đề
-    header_style_vn = ParagraphStyle('header_vn', fontName='DejaVuSans', fontSize=8, alignment=1)
-    header_style_jp = ParagraphStyle('header_jp', fontName='NotoSansJP', fontSize=8, alignment=1)
-    
-    # Tạo chuỗi thời gian làm việc
-    time_str = f"{attendance.check_in.strftime('%H:%M') if attendance.check_in else '-'} - {attendance.check_out.strftime('%H:%M') if attendance.check_out else '-'}"
-    
-    # Xác định hình thức (1 hoặc 2)
-    holiday_type = getattr(attendance, 'holiday_type', None)
-    special_day_types = {'weekend', 'vietnamese_holiday', 'japanese_holiday'}
-    form_type = "2" if holiday_type in special_day_types else "1"
-    
-    # Hàng 1: Tiếng Việt
-    header_row1 = [
-        Paragraph('No.', header_style_vn),
-        Paragraph('NGÀY THÁNG NĂM', header_style_vn),
-        Paragraph('HÌNH THỨC', header_style_vn),
-        Paragraph('CA LÀM VIỆC', header_style_vn),
-        Paragraph('GIỜ VÀO - GIỜ RA', header_style_vn),
-        Paragraph('Thời gian nghỉ đối ứng công việc', header_style_vn),
-        Paragraph('XÁC NHẬN', header_style_vn)
-    ]
-    # Hàng 2: Tiếng Nhật/Hán
-    header_row2 = [
-        Paragraph('', header_style_jp),
-        Paragraph('日付', header_style_jp),
-        Paragraph('種類', header_style_jp),
-        Paragraph('シフト', header_style_jp),
-        Paragraph('出勤時間-退勤時間', header_style_jp),
-        Paragraph('業務対応時間', header_style_jp),
-        Paragraph('ラボマネ承認', header_style_jp)
-    ]
-    # Hàng dữ liệu
-    # Tách riêng thời gian và đối ứng để dễ đọc
-    time_info = f"{attendance.check_in.strftime('%H:%M') if attendance.check_in else '-'} - {attendance.check_out.strftime('%H:%M') if attendance.check_out else '-'}"
-    
-    # Tính tổng thời gian đối ứng - chỉ hiển thị 1 giá trị duy nhất
-    total_comp_time = 0.0
-    
-    # Cộng tất cả các loại đối ứng - SỬ DỤNG CỘT MINUTES MỚI
-    total_comp_minutes = 0
-    total_comp_minutes += attendance.comp_time_regular_minutes or 0
-    total_comp_minutes += attendance.comp_time_overtime_minutes or 0
-    total_comp_minutes += attendance.comp_time_ot_before_22_minutes or 0
-    total_comp_minutes += attendance.comp_time_ot_after_22_minutes or 0
-    total_comp_minutes += attendance.overtime_comp_time_minutes or 0
-    
-    total_comp_time = total_comp_minutes / 60.0
-    
-    # Định dạng tổng thời gian đối ứng
-    if total_comp_time > 0:
-        comp_time_display = attendance._format_hours_minutes(total_comp_time)
-    else:
-        comp_time_display = "0:00"
-    
-    # Tạo dữ liệu hàng với thông tin rõ ràng
-    row_data = [
-        '1',
-        attendance.date.strftime('%d/%m/%Y'),
-        form_type,
-        attendance.shift_code or '-',
-        time_info,
-        comp_time_display,  # Chỉ hiển thị 1 giá trị tổng thời gian đối ứng
-        ''
-    ]
-    
-    table_data = [header_row1, header_row2, row_data]
-    col_widths = [30, 80, 50, 65, 80, 110, 70]  # Tổng nhỏ hơn width, luôn còn margin hai bên
-    row_heights = [40, 14, 18]  # Hàng dữ liệu bình thường vì chỉ hiển thị 1 giá trị
-    
-    detail_table_width = sum(col_widths)
-    x_detail = (width - detail_table_width) / 2
-    table = Table(table_data, colWidths=col_widths, rowHeights=row_heights)
-    table.setStyle(TableStyle([
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('BOX', (0,0), (-1,-1), 0.5, colors.black),
-        ('INNERGRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('FONTNAME', (0,0), (-1,0), 'DejaVuSans'),
-        ('FONTNAME', (0,1), (-1,1), 'NotoSansJP'),
-        ('FONTSIZE', (0,0), (-1,1), 8),
-        ('FONTSIZE', (0,2), (-1,2), 9),
-        # Xóa dòng kẻ ngang giữa hàng 0 và 1
-        ('LINEBELOW', (0,0), (-1,0), 0, colors.white),
-    ]))
-    table.wrapOn(c, width-2*margin, 50)
-    table.drawOn(c, x_detail, table_y - 46)
-    y = table_y - 46 - 36  # cập nhật y cho phần tiếp theo
-    
-    # Ghi chú dưới bảng
-    note_sections = [
-        ("DejaVuSans", 8, "* Ghi chú: Tại cột Hình thức: Tăng ca ngày bình thường ghi số 1 Đi làm ngày nghỉ, tăng ca ghi số 2"),
-        ("NotoSansJP-Light", 8, "備考：平日の残業の場合：1番を記入してください。 休日出勤の場合：2番を記入してください。"),
-        ("DejaVuSans", 8, "*Về việc nghỉ giải lao (60 phút) ngày thường trong tuần, trường hợp nếu nghỉ dài hơn vì đối ứng công việc ：Hãy nộp đơn cho bộ phận văn phòng."),
-        ("NotoSansJP-Light", 8, "通常（1の場合）の昼休憩（60分）に、休憩途中で業務対応する場合、申請をして下さい。"),
-        ("DejaVuSans", 8, "*Trong trường hợp không xin phép trước, thì tăng ca và đi làm ngày nghỉ không được chấp nhận."),
-        ("DejaVuSans", 8, "Phải ghi giấy tăng ca sau khi tăng ca (chậm nhất là ngày mai) ,sang ngày mốt ghi tăng ca thì không được chấp nhận."),
-        ("NotoSansJP-Light", 8, "※1分単位で申請して下さい。申請をしない限り、残業と休日出勤は反映されません。"),
-        ("NotoSansJP-Light", 8, "必ず、残業をした日に申請すること。（次の日までの申請は認めますが、それ以外の申請は認めません）")
-    ]
-    max_note_width = width - 2*margin - 10
-    for i, (font_name, font_size, text) in enumerate(note_sections):
-        lines = wrap_text(text, font_name, font_size, max_note_width, c)
-        for line in lines:
-            c.setFont(font_name, font_size)
-            c.drawString(margin, y, line)
-            y -= font_size + 1
-        # Thêm dòng trắng sau mỗi đoạn bắt đầu bằng * (trừ đoạn cuối)
-        if text.startswith('*') and i < len(note_sections)-1:
-            y -= font_size + 1
-    
-    # Thêm khoảng cách giữa phần ghi chú và dòng ngày tháng
-    y -= 25
-    # Ngày tháng - Đặt ở vị trí cao hơn để không bị đè
-    date_y = y + 20  # Đặt dòng ngày tháng cao hơn
-    c.setFont("DejaVuSans", 10)
-    c.drawRightString(width-margin, date_y, f"Huế, ngày {attendance.date.day} tháng {attendance.date.month} năm {attendance.date.year}")
-    y -= 10  # Đẩy dòng ngày tháng xuống thấp hơn
-    y -= 95  # Tăng thêm khoảng cách để không bị đè lên phần ghi chú và dòng ngày tháng
-    
-    # --- Căn chỉnh lại phần chữ ký và tiêu đề phía trên ---
-    # Số ô và kích thước - TĂNG KÍCH THƯỚC Ô ĐỂ CHỮ KÝ LỚN HƠN KHI IN
-    num_boxes = 3
-    box_width = 170  # Tăng từ 140 lên 170 để chữ ký lớn hơn khi in
-    box_height = 90  # Tăng từ 70 lên 90 để có nhiều không gian cho chữ ký
-    box_spacing = 20  # Giảm khoảng cách để 3 ô vẫn vừa trang
-    total_width = num_boxes * box_width + (num_boxes - 1) * box_spacing
-    start_x = (width - total_width) / 2
-    box_y = y  # y là vị trí đáy các ô
-    label_font_size = 10
-    sublabel_font_size = 8
-    # Tiêu đề các ô
-    box_titles = [
-        ("Quản lí", "ラボマネジャー"),
-        ("Cấp trên trực tiếp", "□室長　□リーダー　□他"),
-        ("Người xin phép", "申請者")
-    ]
-    # Vẽ tiêu đề và sublabel căn giữa trên mỗi ô
-    for i, (title, sublabel) in enumerate(box_titles):
-        x = start_x + i * (box_width + box_spacing)
-        # Căn giữa tiêu đề
-        c.setFont("DejaVuSans", label_font_size)
-        c.drawCentredString(x + box_width/2, box_y + box_height + 22, title)
-        c.setFont("NotoSansJP-Light", sublabel_font_size)
-        c.drawCentredString(x + box_width/2, box_y + box_height + 10, sublabel)
-    # Vẽ các ô chữ ký với border - SẼ ĐƯỢC VẼ LẠI SAU KHI VẼ CHỮ KÝ
-    signature_boxes = []
-    for i in range(num_boxes):
-        x = start_x + i * (box_width + box_spacing)
-        signature_boxes.append((x, box_y, box_width, box_height))
-    # Hiển thị chữ ký hoặc (chưa ký) căn giữa trong từng ô
-    # Quản lý
-    x0 = start_x
-    signature_area_height = box_height - 20  # Tăng vùng chữ ký để chữ ký lớn hơn khi in
-    signature_y = box_y + 20  # Chữ ký ở phần trên (cách đáy 20px)
-    signature_center_y = signature_y + signature_area_height/2 - 8/2  # Căn giữa chữ ký
-    name_y = box_y + 8  # Tên người ký ở phần dưới (cách đáy 8px)
-    
-    if manager_signature:
-        print(f"DEBUG: Processing manager signature for PDF")
-        debug_signature_data(manager_signature, "manager")
-        success = draw_signature_with_proper_scaling(c, manager_signature, x0, signature_y, box_width, signature_area_height)
-        if not success:
-            print(f"DEBUG: Failed to draw manager signature, creating placeholder")
-            create_signature_placeholder(c, x0, signature_y, box_width, signature_area_height, "Lỗi hiển thị")
-    else:
-        c.setFont("DejaVuSans", 8)
-        c.drawCentredString(x0 + box_width/2, signature_center_y, "(chưa ký)")
-    
-    # Thêm tên người ký quản lý bên trong ô chữ ký (phía dưới chữ ký)
-    c.setFont("DejaVuSans", 8)
-    c.drawCentredString(x0 + box_width/2, name_y, manager_signer_name)
-    
-    # Trưởng nhóm
-    x1 = start_x + 1 * (box_width + box_spacing)
-    
-    if team_leader_signature:
-        print(f"DEBUG: Processing team leader signature for PDF")
-        debug_signature_data(team_leader_signature, "team_leader")
-        success = draw_signature_with_proper_scaling(c, team_leader_signature, x1, signature_y, box_width, signature_area_height)
-        if not success:
-            print(f"DEBUG: Failed to draw team leader signature, creating placeholder")
-            create_signature_placeholder(c, x1, signature_y, box_width, signature_area_height, "Lỗi hiển thị")
-    else:
-        c.setFont("DejaVuSans", 8)
-        c.drawCentredString(x1 + box_width/2, signature_center_y, "(chưa ký)")
-    
-    # Thêm tên người ký trưởng nhóm bên trong ô chữ ký (phía dưới chữ ký)
-    c.setFont("DejaVuSans", 8)
-    c.drawCentredString(x1 + box_width/2, name_y, team_leader_signer_name)
-    
-    # Nhân viên
-    x2 = start_x + 2 * (box_width + box_spacing)
-    
-    if employee_signature:
-        print(f"DEBUG: Processing employee signature for PDF")
-        debug_signature_data(employee_signature, "employee")
-        success = draw_signature_with_proper_scaling(c, employee_signature, x2, signature_y, box_width, signature_area_height)
-        if not success:
-            print(f"DEBUG: Failed to draw employee signature, creating placeholder")
-            create_signature_placeholder(c, x2, signature_y, box_width, signature_area_height, "Lỗi hiển thị")
-    else:
-        c.setFont("DejaVuSans", 8)
-        c.drawCentredString(x2 + box_width/2, signature_center_y, "(chưa ký)")
-    
-    # Thêm tên người ký nhân viên bên trong ô chữ ký (phía dưới chữ ký)
-    c.setFont("DejaVuSans", 8)
-    c.drawCentredString(x2 + box_width/2, name_y, employee_signer_name)
-    
-    # Vẽ lại border cho tất cả các ô chữ ký sau khi đã vẽ chữ ký
-    c.setStrokeColor(colors.black)
-    c.setLineWidth(0.5)
-    for x, y, w, h in signature_boxes:
-        c.rect(x, y, w, h, stroke=1, fill=0)
-    
-    c.save()
-
 @app.route('/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':
@@ -15516,11 +15051,8 @@ Hệ thống chấm công DMI"""
     msg.attach(html_part)
     
     try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.sendmail(from_email, [to_email], msg.as_string())
-        server.quit()
+        # Worker outbox gửi (kết nối SMTP dùng lại, tự thử lại khi lỗi tạm thời) - request không chờ SMTP
+        email_outbox.enqueue(msg, from_email, [to_email], KIND_PASSWORD_RESET)
         return True
     except Exception as e:
         print('Email send error:', e)
@@ -15596,42 +15128,6 @@ def debug_signature(attendance_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Thêm hàm debug chữ ký
-def debug_signature_data(signature_data, source="unknown"):
-    """Debug chi tiết dữ liệu chữ ký"""
-    print(f"=== DEBUG SIGNATURE DATA ({source}) ===")
-    if not signature_data:
-        print("Signature data is None or empty")
-        return
-    
-    print(f"Type: {type(signature_data)}")
-    print(f"Length: {len(signature_data)}")
-    
-    if isinstance(signature_data, str):
-        print(f"Starts with 'data:image': {signature_data.startswith('data:image')}")
-        print(f"First 100 chars: {signature_data[:100]}")
-        print(f"Last 100 chars: {signature_data[-100:]}")
-        
-        # Kiểm tra có phải base64 không
-        try:
-            decoded = base64.b64decode(signature_data)
-            print(f"Valid base64: Yes, decoded length: {len(decoded)}")
-        except Exception:
-            print("Valid base64: No")
-            
-            # Thử giải mã nếu có thể
-            try:
-                decrypted = signature_manager.decrypt_signature(signature_data)
-                if decrypted:
-                    print(f"Decrypted successfully, length: {len(decrypted)}")
-                    print(f"Decrypted starts with 'data:image': {decrypted.startswith('data:image')}")
-                else:
-                    print("Decryption failed or returned empty")
-            except Exception as e:
-                print(f"Decryption error: {e}")
-    
-    print("=== END DEBUG ===")
-
 @app.route('/personal-signature', methods=['GET', 'POST'])
 @login_required
 def personal_signature():
@@ -15868,6 +15364,7 @@ def signature_test():
 @app.route('/signature-test/download-pdf', methods=['POST'])
 def download_signature_test_pdf():
     """Tải PDF test chữ ký"""
+    from reportlab.lib.pagesizes import A4
     if 'user_id' not in session:
         return jsonify({'error': 'Không có quyền truy cập'}), 401
     
@@ -15965,6 +15462,7 @@ def download_signature_test_pdf():
 @app.route('/settings/test-signature-pdf', methods=['POST'])
 def test_signature_pdf():
     """Tạo PDF test chữ ký cá nhân trên mẫu phiếu tăng ca thực tế"""
+    from reportlab.lib.pagesizes import A4
     print("DEBUG: test_signature_pdf route accessed")
     print("DEBUG: Session user_id:", session.get('user_id'))
     print("DEBUG: Form data:", request.form)
@@ -16010,6 +15508,7 @@ def test_signature_pdf():
 
 def create_overtime_test_pdf(canvas_obj, user, signature):
     """Tạo PDF test với mẫu phiếu tăng ca thực tế"""
+    from reportlab.lib.pagesizes import A4
     width, height = A4
     margin = 30
     y = height - margin
@@ -16343,6 +15842,117 @@ def remove_vietnamese_accents(text):
     
     return result
 
+def _build_bulk_sheet_attendance_data(attendance, approver_name):
+    """
+    Dữ liệu ghi Google Sheet cho 1 bản ghi được ADMIN duyệt hàng loạt (giống duyệt đơn lẻ).
+    Trả về (employee_team, employee_id, attendance_data) cho batch_update_multi_attendances_sync.
+    """
+    employee_team = attendance.user.department if attendance.user.department else None
+    employee_id = attendance.user.employee_id if attendance.user.employee_id else None
+
+    # Fallbacks
+    if not employee_id:
+        employee_id = str(attendance.user.id) if attendance.user.id else attendance.user.name
+
+    if not employee_team or employee_team == "Unknown":
+        employee_team = getattr(attendance.user, 'team', None) or "Unknown"
+
+    # Prepare attendance data (same as single approval)
+    break_time_value = attendance._format_hours_minutes(attendance.break_time) if attendance.break_time else '0:00'
+    note_value = attendance.note if attendance.note else ''
+
+    comp_time_regular_value = attendance._format_minutes_to_hhmm(attendance.comp_time_regular_minutes)
+    comp_time_overtime_value = attendance._format_minutes_to_hhmm(attendance.comp_time_overtime_minutes)
+    comp_time_ot_before_22_value = attendance._format_minutes_to_hhmm(attendance.comp_time_ot_before_22_minutes)
+    comp_time_ot_after_22_value = attendance._format_minutes_to_hhmm(attendance.comp_time_ot_after_22_minutes)
+    overtime_comp_time_value = attendance._format_minutes_to_hhmm(attendance.overtime_comp_time_minutes)
+
+    overtime_before_22_val = attendance.overtime_before_22 or '0:00'
+    overtime_after_22_val = attendance.overtime_after_22 or '0:00'
+
+    # Calculate total comp time
+    def hhmm_to_minutes_safe(v):
+        try:
+            if not v or v in ['0', '0:00']:
+                return 0
+            if isinstance(v, str) and ':' in v:
+                h, m = v.split(':', 1)
+                return int(h or '0') * 60 + int(m or '0')
+        except Exception:
+            pass
+        return 0
+
+    total_comp_minutes = (
+        hhmm_to_minutes_safe(comp_time_regular_value) +
+        hhmm_to_minutes_safe(comp_time_ot_before_22_value) +
+        hhmm_to_minutes_safe(comp_time_ot_after_22_value) +
+        hhmm_to_minutes_safe(comp_time_overtime_value) +
+        hhmm_to_minutes_safe(overtime_comp_time_value)
+    )
+    total_comp_display = f"{total_comp_minutes // 60}:{total_comp_minutes % 60:02d}"
+
+    doi_ung_parts = []
+    if comp_time_regular_value not in [None, '', 0, '0', '0:00']:
+        doi_ung_parts.append(f"Bù giờ thường: {comp_time_regular_value}")
+    if comp_time_overtime_value not in [None, '', 0, '0', '0:00']:
+        doi_ung_parts.append(f"Bù giờ tăng ca: {comp_time_overtime_value}")
+    if comp_time_ot_before_22_value not in [None, '', 0, '0', '0:00']:
+        doi_ung_parts.append(f"Bù OT <22h: {comp_time_ot_before_22_value}")
+    if comp_time_ot_after_22_value not in [None, '', 0, '0', '0:00']:
+        doi_ung_parts.append(f"Bù OT >22h: {comp_time_ot_after_22_value}")
+    if overtime_comp_time_value not in [None, '', 0, '0', '0:00']:
+        doi_ung_parts.append(f"Đối ứng OT: {overtime_comp_time_value}")
+
+    doi_ung_summary = f"{total_comp_display} [ " + ' | '.join(doi_ung_parts) + " ]" if doi_ung_parts else total_comp_display
+
+    regular_work_display = attendance._format_hours_minutes(attendance.calculate_regular_work_hours())
+    total_hours_value = getattr(attendance, 'total_hours', None) or getattr(attendance, 'total_work_hours', '')
+
+    def to_hhmm_from_decimal(hours_val):
+        try:
+            if hours_val is None or hours_val == '':
+                return ''
+            if isinstance(hours_val, str):
+                if ':' in hours_val:
+                    return hours_val
+                hours_float = float(hours_val)
+            else:
+                hours_float = float(hours_val)
+            total_minutes = int(round(hours_float * 60))
+            return f"{total_minutes // 60}:{total_minutes % 60:02d}"
+        except Exception:
+            return str(hours_val)
+
+    total_hours_display = to_hhmm_from_decimal(total_hours_value)
+
+    attendance_data = {
+        'id': attendance.id,
+        'user_name': attendance.user.name if attendance.user else 'Unknown',
+        'date': attendance.date.strftime('%Y-%m-%d') if attendance.date else '',
+        'check_in': attendance.check_in.strftime('%H:%M') if attendance.check_in else '',
+        'check_out': attendance.check_out.strftime('%H:%M') if attendance.check_out else '',
+        'total_hours': total_hours_display,
+        'regular_work_hours': regular_work_display,
+        'break_time': break_time_value,
+        'overtime_before_22': overtime_before_22_val,
+        'overtime_after_22': overtime_after_22_val,
+        'comp_time_regular': comp_time_regular_value,
+        'comp_time_overtime': comp_time_overtime_value,
+        'comp_time_ot_before_22': comp_time_ot_before_22_value,
+        'comp_time_ot_after_22': comp_time_ot_after_22_value,
+        'overtime_comp_time': overtime_comp_time_value,
+        'note': note_value,
+        'doi_ung': doi_ung_summary,
+        'doi_ung_total': total_comp_display,
+        'status': 'approved',
+        'approved_by': approver_name,
+        'approved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'holiday_type': attendance.holiday_type if hasattr(attendance, 'holiday_type') else None,
+        'is_holiday': attendance.is_holiday if hasattr(attendance, 'is_holiday') else False
+    }
+
+    return employee_team, employee_id, attendance_data
+
 # API endpoint để phê duyệt tất cả attendance records
 @app.route('/api/attendance/approve-all', methods=['POST'])
 @rate_limit(max_requests=10, window_seconds=60)  # Giới hạn 10 lần gọi API trong 1 phút
@@ -16373,382 +15983,133 @@ def approve_all_attendances():
     if action == 'reject' and not reason:
         return jsonify({'error': 'Lý do từ chối không hợp lệ'}), 400
     
-    # Import datetime at function level to avoid scope issues
-    import sys
-    from datetime import datetime as dt
+    from utils.bulk_approval import (
+        ATTENDANCE_PENDING_STATUSES, BulkApprovalProgress, iter_keyset_chunks, chunked, bulk_update,
+        log_bulk_audit, attendance_step_values, attendance_final_values, attendance_reject_values,
+    )
     
     try:
-        # Xác định phạm vi attendance records cần phê duyệt
-        if current_role == 'ADMIN':
-            # Admin có thể phê duyệt tất cả
-            attendances_query = Attendance.query.filter(
-                Attendance.approved == False
-            )
-        elif current_role == 'MANAGER':
-            # Manager có thể phê duyệt tất cả nhân viên (không phân biệt phòng ban)
-            # Bao gồm cả nhân viên từ các phòng ban khác
-            attendances_query = Attendance.query.filter(
-                Attendance.approved == False
-            )
-        else:  # TEAM_LEADER
-            # Team leader chỉ có thể phê duyệt nhân viên cùng phòng ban
-            attendances_query = Attendance.query.join(User, Attendance.user_id == User.id).filter(
-                Attendance.approved == False,
-                User.department == user.department
-            )
-        
-        # Lọc theo trạng thái hiện tại
+        # Phạm vi: ADMIN/MANAGER tất cả nhân viên, TEAM_LEADER chỉ nhân viên cùng phòng ban;
+        # mỗi role chỉ xử lý các trạng thái chờ duyệt của mình
+        pending_statuses = ATTENDANCE_PENDING_STATUSES[current_role]
+        attendances_query = Attendance.query.filter(
+            Attendance.approved == False,
+            Attendance.status.in_(pending_statuses)
+        )
         if current_role == 'TEAM_LEADER':
-            attendances_query = attendances_query.filter(Attendance.status == 'pending')
-        elif current_role == 'MANAGER':
-            # Manager chỉ có thể phê duyệt pending và pending_manager
-            attendances_query = attendances_query.filter(
-                Attendance.status.in_(['pending', 'pending_manager'])
-            )
-        elif current_role == 'ADMIN':
-            # Admin có thể phê duyệt tất cả trạng thái chờ duyệt
-            attendances_query = attendances_query.filter(
-                Attendance.status.in_(['pending', 'pending_manager', 'pending_admin'])
-            )
-        
-        attendances = attendances_query.all()
+            attendances_query = attendances_query.filter(Attendance.user_id.in_(User.team_ids(user.department)))
+        # Điều kiện lặp lại trong UPDATE: bản ghi vừa được người khác xử lý sẽ không bị ghi đè
+        guards = (Attendance.approved == False, Attendance.status.in_(pending_statuses))
         
-        if not attendances:
+        total = attendances_query.count()
+        if not total:
             return jsonify({'message': 'Không có bản ghi nào cần phê duyệt', 'count': 0}), 200
         
+        # Giá trị thuần của người duyệt (commit sau mỗi lô sẽ expire object user)
+        approver_id = user.id
+        approver_name = user.name
+        signature = user.personal_signature if user.has_personal_signature() else None
+        progress = BulkApprovalProgress(approver_id, 'attendance', total)
+        progress.publish('start')
+        
         approved_count = 0
         rejected_count = 0
         approved_attendance_ids = []  # Lưu ID các bản ghi đã được ADMIN phê duyệt để cập nhật Google Sheet
         google_sheet_errors = []  # Lưu các lỗi khi cập nhật Google Sheet (chỉ cho ADMIN)
-
-        # ===== BATCH UPDATE OPTIMIZATION FOR ADMIN =====
-        # Gom tất cả ADMIN records để batch update thay vì update từng record
-        admin_records_for_batch = []  # List of (attendance, employee_team, employee_id, attendance_data, original_status)
-
-        for attendance in attendances:
-            # Kiểm tra quyền phê duyệt từng record
-            has_permission, error_message = check_approval_permission(user.id, attendance.id, current_role)
-            if not has_permission:
-                continue
-            
-            if action == 'approve':
-                # Xử lý phê duyệt
-                if current_role == 'TEAM_LEADER':
-                    attendance.status = 'pending_manager'
-                    attendance.approved_by = user.id
-                    attendance.approved_at = datetime.now()
-                    # Lưu chữ ký và ID người ký nếu có
-                    if user.has_personal_signature():
-                        attendance.team_leader_signature = user.personal_signature
-                    attendance.team_leader_signer_id = user.id  # Cập nhật ID người ký trưởng nhóm
-                elif current_role == 'MANAGER':
-                    # Manager chuyển lên QUẢN TRỊ VIÊN để kiểm tra cuối cùng
-                    # Nếu trạng thái là pending, cần lưu chữ ký trưởng nhóm (nếu có)
-                    if attendance.status == 'pending' and user.has_personal_signature():
-                        attendance.team_leader_signature = user.personal_signature
-                        # Cập nhật ID người ký trưởng nhóm nếu chưa có
-                        if not attendance.team_leader_signer_id:
-                            attendance.team_leader_signer_id = user.id
-                    
-                    attendance.status = 'pending_admin'
-                    attendance.approved_by = user.id
-                    attendance.approved_at = datetime.now()
-                    # Lưu chữ ký quản lý nếu có
-                    if user.has_personal_signature():
-                        attendance.manager_signature = user.personal_signature
-                    attendance.manager_signer_id = user.id  # Cập nhật ID người ký quản lý
-                elif current_role == 'ADMIN':
-                    # ===== ADMIN BULK APPROVAL WITH BATCH GOOGLE SHEET UPDATE =====
-                    # Thay vì sync từng record, gom lại để batch update sau
-
-                    # Check Google API token một lần đầu tiên
-                    if len(admin_records_for_batch) == 0:
-                        token_status = check_google_token_status()
-                        if not token_status.get('can_approve', False):
-                            publish_token_status('expired', token_status.get('message', 'Token hết hạn'), needs_reauth=True)
-                            return jsonify({
-                                'error': f"⚠️ Token Google API hết hạn. {token_status.get('message', 'Vui lòng refresh token trước khi phê duyệt.')}",
-                                'error_code': 'token_expired',
-                                'needs_reauth': True
-                            }), 503
-
-                    # Store original status for rollback
-                    original_status = attendance.status
-
-                    # Save signatures first
-                    if attendance.status == 'pending' and user.has_personal_signature():
-                        attendance.team_leader_signature = user.personal_signature
-                        attendance.team_leader_signer_id = user.id
-
-                    if attendance.status == 'pending_manager' and user.has_personal_signature():
-                        attendance.manager_signature = user.personal_signature
-                        attendance.manager_signer_id = user.id
-
-                    if attendance.status == 'pending_admin' and user.has_personal_signature():
-                        attendance.manager_signature = user.personal_signature
-                        attendance.manager_signer_id = user.id
-
-                    # Prepare attendance data like single approval
-                    if not attendance.user:
-                        continue  # Skip records without user info
-
-                    employee_team = attendance.user.department if attendance.user.department else None
-                    employee_id = attendance.user.employee_id if attendance.user.employee_id else None
-
-                    # Fallbacks
-                    if not employee_id:
-                        employee_id = str(attendance.user.id) if attendance.user.id else attendance.user.name
-
-                    if not employee_team or employee_team == "Unknown":
-                        employee_team = getattr(attendance.user, 'team', None) or "Unknown"
-
-                    # Prepare attendance data (same as single approval)
-                    break_time_value = attendance._format_hours_minutes(attendance.break_time) if attendance.break_time else '0:00'
-                    note_value = attendance.note if attendance.note else ''
-
-                    comp_time_regular_value = attendance._format_minutes_to_hhmm(attendance.comp_time_regular_minutes)
-                    comp_time_overtime_value = attendance._format_minutes_to_hhmm(attendance.comp_time_overtime_minutes)
-                    comp_time_ot_before_22_value = attendance._format_minutes_to_hhmm(attendance.comp_time_ot_before_22_minutes)
-                    comp_time_ot_after_22_value = attendance._format_minutes_to_hhmm(attendance.comp_time_ot_after_22_minutes)
-                    overtime_comp_time_value = attendance._format_minutes_to_hhmm(attendance.overtime_comp_time_minutes)
-
-                    overtime_before_22_val = attendance.overtime_before_22 or '0:00'
-                    overtime_after_22_val = attendance.overtime_after_22 or '0:00'
-
-                    # Calculate total comp time
-                    def hhmm_to_minutes_safe(v):
-                        try:
-                            if not v or v in ['0', '0:00']:
-                                return 0
-                            if isinstance(v, str) and ':' in v:
-                                h, m = v.split(':', 1)
-                                return int(h or '0') * 60 + int(m or '0')
-                        except Exception:
-                            pass
-                        return 0
-
-                    total_comp_minutes = (
-                        hhmm_to_minutes_safe(comp_time_regular_value) +
-                        hhmm_to_minutes_safe(comp_time_ot_before_22_value) +
-                        hhmm_to_minutes_safe(comp_time_ot_after_22_value) +
-                        hhmm_to_minutes_safe(comp_time_overtime_value) +
-                        hhmm_to_minutes_safe(overtime_comp_time_value)
-                    )
-                    total_comp_display = f"{total_comp_minutes // 60}:{total_comp_minutes % 60:02d}"
-
-                    doi_ung_parts = []
-                    if comp_time_regular_value not in [None, '', 0, '0', '0:00']:
-                        doi_ung_parts.append(f"Bù giờ thường: {comp_time_regular_value}")
-                    if comp_time_overtime_value not in [None, '', 0, '0', '0:00']:
-                        doi_ung_parts.append(f"Bù giờ tăng ca: {comp_time_overtime_value}")
-                    if comp_time_ot_before_22_value not in [None, '', 0, '0', '0:00']:
-                        doi_ung_parts.append(f"Bù OT <22h: {comp_time_ot_before_22_value}")
-                    if comp_time_ot_after_22_value not in [None, '', 0, '0', '0:00']:
-                        doi_ung_parts.append(f"Bù OT >22h: {comp_time_ot_after_22_value}")
-                    if overtime_comp_time_value not in [None, '', 0, '0', '0:00']:
-                        doi_ung_parts.append(f"Đối ứng OT: {overtime_comp_time_value}")
-
-                    doi_ung_summary = f"{total_comp_display} [ " + ' | '.join(doi_ung_parts) + " ]" if doi_ung_parts else total_comp_display
-
-                    regular_work_display = attendance._format_hours_minutes(attendance.calculate_regular_work_hours())
-                    total_hours_value = getattr(attendance, 'total_hours', None) or getattr(attendance, 'total_work_hours', '')
-
-                    def to_hhmm_from_decimal(hours_val):
-                        try:
-                            if hours_val is None or hours_val == '':
-                                return ''
-                            if isinstance(hours_val, str):
-                                if ':' in hours_val:
-                                    return hours_val
-                                hours_float = float(hours_val)
-                            else:
-                                hours_float = float(hours_val)
-                            total_minutes = int(round(hours_float * 60))
-                            return f"{total_minutes // 60}:{total_minutes % 60:02d}"
-                        except Exception:
-                            return str(hours_val)
-
-                    total_hours_display = to_hhmm_from_decimal(total_hours_value)
-
-                    attendance_data = {
-                        'id': attendance.id,
-                        'user_name': attendance.user.name if attendance.user else 'Unknown',
-                        'date': attendance.date.strftime('%Y-%m-%d') if attendance.date else '',
-                        'check_in': attendance.check_in.strftime('%H:%M') if attendance.check_in else '',
-                        'check_out': attendance.check_out.strftime('%H:%M') if attendance.check_out else '',
-                        'total_hours': total_hours_display,
-                        'regular_work_hours': regular_work_display,
-                        'break_time': break_time_value,
-                        'overtime_before_22': overtime_before_22_val,
-                        'overtime_after_22': overtime_after_22_val,
-                        'comp_time_regular': comp_time_regular_value,
-                        'comp_time_overtime': comp_time_overtime_value,
-                        'comp_time_ot_before_22': comp_time_ot_before_22_value,
-                        'comp_time_ot_after_22': comp_time_ot_after_22_value,
-                        'overtime_comp_time': overtime_comp_time_value,
-                        'note': note_value,
-                        'doi_ung': doi_ung_summary,
-                        'doi_ung_total': total_comp_display,
-                        'status': 'approved',
-                        'approved_by': user.name,
-                        'approved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'holiday_type': attendance.holiday_type if hasattr(attendance, 'holiday_type') else None,
-                        'is_holiday': attendance.is_holiday if hasattr(attendance, 'is_holiday') else False
-                    }
-
-                    # ===== GOM RECORD VÀO LIST ĐỂ BATCH UPDATE SAU =====
-                    admin_records_for_batch.append({
-                        'attendance': attendance,
-                        'employee_team': employee_team,
-                        'employee_id': employee_id,
-                        'attendance_data': attendance_data,
-                        'original_status': original_status
-                    })
-
-                    # Không tăng approved_count ở đây - sẽ xử lý sau khi batch update
-                    continue  # Skip to next record, batch update sẽ xử lý sau
-
-                approved_count += 1
-
-                # Log audit action (cho TEAM_LEADER và MANAGER)
-                log_audit_action(
-                    user_id=user.id,
-                    action='BULK_APPROVE_ATTENDANCE',
-                    table_name='attendances',
-                    record_id=attendance.id,
-                    old_values={'status': attendance.status},
-                    new_values={
-                        'status': attendance.status,
-                        'approved_by': user.id,
-                        'team_leader_signer_id': getattr(attendance, 'team_leader_signer_id', None),
-                        'manager_signer_id': getattr(attendance, 'manager_signer_id', None)
-                    }
-                )
-
-            else:  # reject
-                attendance.status = 'rejected'
-                attendance.reject_reason = reason
-                attendance.approved_by = user.id
-                attendance.approved_at = datetime.now()
-                rejected_count += 1
+        
+        if action == 'reject' or current_role != 'ADMIN':
+            # ===== TEAM_LEADER / MANAGER DUYỆT, HOẶC TỪ CHỐI: 1 UPDATE + 1 AUDIT MỖI LÔ =====
+            id_query = attendances_query.with_entities(Attendance.id, Attendance.status)
+            for rows in iter_keyset_chunks(id_query, Attendance.id):
+                ids = [row.id for row in rows]
+                now = datetime.now()
+                if action == 'reject':
+                    changed = bulk_update(Attendance, ids, attendance_reject_values(approver_id, reason, now), *guards)
+                    new_status = 'rejected'
+                    rejected_count += changed
+                else:
+                    changed = bulk_update(Attendance, ids, attendance_step_values(current_role, approver_id, signature, now), *guards)
+                    new_status = 'pending_manager' if current_role == 'TEAM_LEADER' else 'pending_admin'
+                    approved_count += changed
+                db.session.commit()
                 
-                # Log audit action
-                log_audit_action(
-                    user_id=user.id,
-                    action='BULK_REJECT_ATTENDANCE',
-                    table_name='attendances',
-                    record_id=attendance.id,
-                    old_values={'status': attendance.status},
-                    new_values={'status': 'rejected', 'reject_reason': reason, 'approved_by': user.id}
+                new_values = {'status': new_status, 'approved_by': approver_id, 'updated': changed}
+                if action == 'reject':
+                    new_values['reject_reason'] = reason
+                log_bulk_audit(
+                    approver_id,
+                    'BULK_REJECT_ATTENDANCE' if action == 'reject' else 'BULK_APPROVE_ATTENDANCE',
+                    'attendances', ids, (row.status for row in rows), new_values
                 )
-
-        # ===== BATCH UPDATE GOOGLE SHEETS FOR ADMIN RECORDS =====
-        if current_role == 'ADMIN' and action == 'approve' and admin_records_for_batch:
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            try:
-                print(f"\n{'='*80}", flush=True, file=sys.stderr)
-                print(f"🚀 [BATCH_UPDATE_START] {timestamp} - Bắt đầu BATCH UPDATE cho {len(admin_records_for_batch)} records", flush=True, file=sys.stderr)
-                print(f"{'='*80}", flush=True, file=sys.stderr)
-            except Exception:
-                pass
-
-            # Chuẩn bị dữ liệu cho batch update
-            batch_data = []
-            for record in admin_records_for_batch:
-                batch_data.append((
-                    record['attendance'],
-                    record['employee_team'],
-                    record['employee_id'],
-                    record['attendance_data']
-                ))
-
-            # Gọi batch update
-            batch_result = batch_update_multi_attendances_sync(batch_data)
-
-            # Xử lý kết quả batch update
-            for record in admin_records_for_batch:
-                attendance = record['attendance']
-                original_status = record['original_status']
-
-                if attendance.id in batch_result['success_ids']:
-                    # Google Sheet thành công - mark as approved
-                    attendance.status = 'approved'
-                    attendance.approved = True
-                    attendance.approved_by = user.id
-                    attendance.approved_at = datetime.now()
-                    # B3: Increment version on batch approval
-                    attendance.version = (getattr(attendance, 'version', 1) or 1) + 1
-                    approved_attendance_ids.append(attendance.id)
-                    approved_count += 1
-
-                    # Log audit action
-                    log_audit_action(
-                        user_id=user.id,
-                        action='BULK_APPROVE_ATTENDANCE',
-                        table_name='attendances',
-                        record_id=attendance.id,
-                        old_values={'status': original_status},
-                        new_values={
-                            'status': 'approved',
-                            'approved_by': user.id,
-                            'team_leader_signer_id': getattr(attendance, 'team_leader_signer_id', None),
-                            'manager_signer_id': getattr(attendance, 'manager_signer_id', None)
-                        }
-                    )
-                else:
-                    # Google Sheet thất bại - rollback
-                    attendance.approved = False
-                    attendance.approved_by = None
-                    attendance.approved_at = None
-
-                    # Tìm error message
-                    error_msg = 'Unknown error'
-                    for failed in batch_result['failed']:
-                        if failed['id'] == attendance.id:
-                            error_msg = failed['error']
-                            break
-
-                    google_sheet_errors.append({
-                        'id': attendance.id,
-                        'user_name': attendance.user.name if attendance.user else 'Unknown',
-                        'error': error_msg,
-                        'original_status': original_status
-                    })
-
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            try:
-                print(f"\n{'='*80}", flush=True, file=sys.stderr)
-                print(f"📊 [BATCH_UPDATE_COMPLETE] {timestamp}", flush=True, file=sys.stderr)
-                print(f"   ✅ Thành công: {len(batch_result['success_ids'])} records", flush=True, file=sys.stderr)
-                print(f"   ❌ Thất bại: {len(batch_result['failed'])} records", flush=True, file=sys.stderr)
-                print(f"   📡 Tổng API calls: {batch_result['total_api_calls']} (thay vì {len(admin_records_for_batch)} calls)", flush=True, file=sys.stderr)
-                print(f"{'='*80}", flush=True, file=sys.stderr)
-            except Exception:
-                pass
-
-        # ===== COMMIT ALL CHANGES =====
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        try:
-            print(f"\n{'='*80}", flush=True, file=sys.stderr)
-            print(f"💾 [BULK_COMMIT] {timestamp} - Đang commit tất cả thay đổi...", flush=True, file=sys.stderr)
-            print(f"{'='*80}", flush=True, file=sys.stderr)
-        except Exception:
-            pass
+                progress.advance(len(ids), 'update')
         
-        try:
-            db.session.commit()
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            try:
-                print(f"✅ [BULK_COMMIT_SUCCESS] {timestamp} - Database đã được commit", flush=True, file=sys.stderr)
-            except Exception:
-                pass
-        except Exception as commit_error:
-            db.session.rollback()
+        else:
+            # ===== ADMIN BULK APPROVAL WITH BATCH GOOGLE SHEET UPDATE =====
+            # Check Google API token một lần trước khi bắt đầu
+            token_status = check_google_token_status()
+            if not token_status.get('can_approve', False):
+                publish_token_status('expired', token_status.get('message', 'Token hết hạn'), needs_reauth=True)
+                return jsonify({
+                    'error': f"⚠️ Token Google API hết hạn. {token_status.get('message', 'Vui lòng refresh token trước khi phê duyệt.')}",
+                    'error_code': 'token_expired',
+                    'needs_reauth': True
+                }), 503
+            
+            # Bước 1: đọc theo lô (không nạp ảnh chữ ký), chuẩn bị dữ liệu Google Sheet.
+            # Object được tách khỏi session ngay -> identity map không phình theo số bản ghi
+            batch_data = []
+            original_statuses = {}
+            user_names = {}
+            chunk_query = attendances_query.options(
+                joinedload(Attendance.user),
+                *[defer(getattr(Attendance, column)) for column in Attendance.SIGNATURE_COLUMNS]
+            )
+            for chunk in iter_keyset_chunks(chunk_query, Attendance.id):
+                for attendance in chunk:
+                    if attendance.user:  # Skip records without user info
+                        employee_team, employee_id, attendance_data = _build_bulk_sheet_attendance_data(attendance, approver_name)
+                        batch_data.append((attendance, employee_team, employee_id, attendance_data))
+                        original_statuses[attendance.id] = attendance.status
+                        user_names[attendance.id] = attendance.user.name
+                    db.session.expunge(attendance)
+                progress.advance(len(chunk), 'prepare')
+            
+            # Bước 2: 1 lần gọi batch update cho tất cả bản ghi (gom theo spreadsheet / sheet nhân viên)
+            batch_result = {'success_ids': [], 'failed': [], 'total_api_calls': 0}
+            if batch_data:
+                try:
+                    approval_log.debug("🚀 [BATCH_UPDATE_START] Bắt đầu BATCH UPDATE cho %s records", len(batch_data))
+                except Exception:
+                    pass
+                progress.publish('google_sheet')
+                batch_result = batch_update_multi_attendances_sync(batch_data)
+            
+            # Bước 3: chỉ bản ghi cập nhật Google Sheet thành công mới được duyệt (theo lô);
+            # bản ghi thất bại giữ nguyên để thử lại
+            for ids in chunked(batch_result['success_ids']):
+                changed = bulk_update(Attendance, ids, attendance_final_values(approver_id, signature, datetime.now()), *guards)
+                db.session.commit()
+                approved_count += changed
+                approved_attendance_ids.extend(ids)
+                log_bulk_audit(
+                    approver_id, 'BULK_APPROVE_ATTENDANCE', 'attendances', ids,
+                    (original_statuses.get(att_id, '') for att_id in ids),
+                    {'status': 'approved', 'approved_by': approver_id, 'updated': changed}
+                )
+                progress.publish('update', approved=approved_count)
+            
+            for failed in batch_result['failed']:
+                google_sheet_errors.append({
+                    'id': failed['id'],
+                    'user_name': user_names.get(failed['id'], 'Unknown'),
+                    'error': failed['error'],
+                    'original_status': original_statuses.get(failed['id'])
+                })
+            
             try:
-                print(f"❌ [BULK_COMMIT_ERROR] Lỗi commit: {str(commit_error)}", flush=True, file=sys.stderr)
+                approval_log.debug("📊 [BATCH_UPDATE_COMPLETE] ✅ %s / ❌ %s records, 📡 %s API calls", len(batch_result['success_ids']), len(batch_result['failed']), batch_result['total_api_calls'])
             except Exception:
                 pass
-            return jsonify({'error': 'Lỗi lưu database'}), 500
         
         # ===== PREPARE RESPONSE WITH DETAILED SUMMARY =====
         total_processed = approved_count + rejected_count
@@ -16768,26 +16129,15 @@ def approve_all_attendances():
             message += f': {approved_count} phê duyệt, {rejected_count} từ chối'
         
         # Log summary
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         try:
-            print(f"\n{'='*80}", flush=True, file=sys.stderr)
-            print(f"📊 [BULK_APPROVE_SUMMARY] {timestamp}", flush=True, file=sys.stderr)
-            print(f"   Tổng số xử lý: {total_processed}", flush=True, file=sys.stderr)
-            if current_role == 'ADMIN' and action == 'approve':
-                print(f"   ✅ Thành công: {successful_approvals} bản ghi", flush=True, file=sys.stderr)
-                if successful_approvals > 0:
-                    print(f"      IDs: {', '.join(map(str, approved_attendance_ids))}", flush=True, file=sys.stderr)
-                print(f"   ❌ Thất bại: {failed_approvals} bản ghi", flush=True, file=sys.stderr)
-                if failed_approvals > 0:
-                    for error_detail in google_sheet_errors:
-                        print(f"      - ID {error_detail['id']} ({error_detail['user_name']}): {error_detail['error']}", flush=True, file=sys.stderr)
-            else:
-                print(f"   ✅ Phê duyệt: {approved_count}", flush=True, file=sys.stderr)
-            print(f"   ❌ Từ chối: {rejected_count}", flush=True, file=sys.stderr)
-            print(f"{'='*80}\n", flush=True, file=sys.stderr)
+            approval_log.debug("📊 [BULK_APPROVE_SUMMARY] %s %s: %s/%s bản ghi, ✅ %s phê duyệt, ❌ %s từ chối, ⚠️ %s lỗi Google Sheet", current_role, action, total_processed, total, approved_count, rejected_count, failed_approvals)
+            for error_detail in google_sheet_errors[:20]:
+                approval_log.debug("      - ID %s (%s): %s", error_detail['id'], error_detail['user_name'], error_detail['error'])
         except Exception:
             pass
         
+        progress.done(approved=approved_count, rejected=rejected_count, failed=failed_approvals)
+        
         # Prepare detailed error list for response
         error_list = []
         if google_sheet_errors:
@@ -16813,7 +16163,7 @@ def approve_all_attendances():
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error in bulk approval: {e}")
+        approval_log.error("Error in bulk approval: %s", e)
         return jsonify({'error': f'Lỗi khi xử lý hàng loạt: {str(e)}'}), 500
 
 # ============================================================================
@@ -16841,32 +16191,25 @@ def get_leave_pending_count():
         return jsonify({'count': 0}), 200
 
     try:
-        # Xác định phạm vi leave requests có thể phê duyệt theo role
+        # Xác định phạm vi leave requests có thể phê duyệt theo role (đọc từ pending_counters)
         if current_role == 'ADMIN':
             # Admin có thể phê duyệt pending_admin
-            count = LeaveRequest.query.filter(
-                LeaveRequest.status == 'pending_admin'
-            ).count()
             target_status = 'pending_admin'
+            count = pending_counters.count(PENDING_LEAVE, target_status)
         elif current_role == 'MANAGER':
             # Manager có thể phê duyệt pending_manager
-            count = LeaveRequest.query.filter(
-                LeaveRequest.status == 'pending_manager'
-            ).count()
             target_status = 'pending_manager'
+            count = pending_counters.count(PENDING_LEAVE, target_status)
         else:  # TEAM_LEADER
             # Team leader chỉ có thể phê duyệt pending cùng phòng ban
-            count = LeaveRequest.query.join(User, LeaveRequest.user_id == User.id).filter(
-                LeaveRequest.status == 'pending',
-                User.department == user.department
-            ).count()
             target_status = 'pending'
+            count = pending_counters.count(PENDING_LEAVE, target_status, user.department)
 
-        print(f"[INFO] get_leave_pending_count: role={current_role}, target_status={target_status}, count={count}")
+        approval_log.debug("[INFO] get_leave_pending_count: role=%s, target_status=%s, count=%s", current_role, target_status, count)
         return jsonify({'count': count, 'role': current_role, 'target_status': target_status}), 200
 
     except Exception as e:
-        print(f"[ERROR] get_leave_pending_count: {str(e)}")
+        approval_log.error("[ERROR] get_leave_pending_count: %s", str(e))
         return jsonify({'error': str(e), 'count': 0}), 500
 
 # API endpoint để phê duyệt tất cả leave request records
@@ -16900,258 +16243,155 @@ def approve_all_leave_requests():
     if action == 'reject' and not reason:
         return jsonify({'error': 'Lý do từ chối không hợp lệ'}), 400
     
-    # Import datetime at function level to avoid scope issues
-    import sys
-    from datetime import datetime as dt
+    from utils.bulk_approval import (
+        LEAVE_PENDING_STATUSES, BulkApprovalProgress, iter_keyset_chunks, chunked, bulk_update,
+        log_bulk_audit, leave_step_values, leave_final_values, leave_reject_values,
+    )
 
     try:
         # Xác định phạm vi leave requests cần phê duyệt theo đúng role
         # Mỗi role chỉ phê duyệt đúng trạng thái mà họ có thể phê duyệt
-        if current_role == 'ADMIN':
-            # Admin chỉ phê duyệt pending_admin (bước cuối cùng)
-            leave_requests_query = LeaveRequest.query.filter(
-                LeaveRequest.status == 'pending_admin'
-            )
-        elif current_role == 'MANAGER':
-            # Manager chỉ phê duyệt pending_manager
-            leave_requests_query = LeaveRequest.query.filter(
-                LeaveRequest.status == 'pending_manager'
-            )
-        else:  # TEAM_LEADER
-            # Team leader chỉ có thể phê duyệt pending cùng phòng ban
-            leave_requests_query = LeaveRequest.query.join(User, LeaveRequest.user_id == User.id).filter(
-                LeaveRequest.status == 'pending',
-                User.department == user.department
-            )
-        
-        leave_requests = leave_requests_query.all()
-        
-        if not leave_requests:
+        # (ADMIN: pending_admin, MANAGER: pending_manager, TEAM_LEADER: pending cùng phòng ban)
+        pending_statuses = LEAVE_PENDING_STATUSES[current_role]
+        leave_requests_query = LeaveRequest.query.filter(LeaveRequest.status.in_(pending_statuses))
+        if current_role == 'TEAM_LEADER':
+            leave_requests_query = leave_requests_query.filter(LeaveRequest.user_id.in_(User.team_ids(user.department)))
+        # Điều kiện lặp lại trong UPDATE: đơn vừa được người khác xử lý sẽ không bị ghi đè
+        guards = (LeaveRequest.status.in_(pending_statuses),)
+
+        total = leave_requests_query.count()
+        if not total:
             return jsonify({'message': 'Không có đơn nào cần phê duyệt', 'count': 0}), 200
-        
+
+        # Giá trị thuần của người duyệt (commit sau mỗi lô sẽ expire object user)
+        approver_id = user.id
+        signature = user.personal_signature if user.has_personal_signature() else None
+        progress = BulkApprovalProgress(approver_id, 'leave', total)
+        progress.publish('start')
+
         approved_count = 0
         rejected_count = 0
         google_sheet_errors = []  # Lưu các lỗi khi cập nhật Google Sheet (chỉ cho ADMIN)
         approved_leave_ids = []  # Lưu ID các đơn đã được ADMIN phê duyệt
 
-        # ===== BATCH UPDATE OPTIMIZATION FOR ADMIN =====
-        # Gom tất cả ADMIN records để batch update thay vì update từng record
-        admin_records_for_batch = []  # List of dicts for batch processing
-
-        # Xử lý từng leave request
-        for leave_request in leave_requests:
-            if action == 'approve':
-                # Xử lý phê duyệt theo từng role
-                if current_role == 'TEAM_LEADER':
-                    # Team leader approve: pending -> pending_manager
-                    if leave_request.status == 'pending' and user.has_personal_signature():
-                        leave_request.team_leader_signature = user.personal_signature
-                        leave_request.team_leader_signer_id = user.id
-                        leave_request.team_leader_approved_at = datetime.now()
-
-                    leave_request.status = 'pending_manager'
-                    leave_request.step = 'manager'
-                    leave_request.current_approver_id = None
-                    approved_count += 1
-
-                elif current_role == 'MANAGER':
-                    # Manager approve: pending/pending_manager -> pending_admin
-                    # Nếu chưa có chữ ký team leader, thêm chữ ký manager vào vị trí team leader
-                    if leave_request.status == 'pending' and user.has_personal_signature():
-                        leave_request.team_leader_signature = user.personal_signature
-                        leave_request.team_leader_signer_id = user.id
-
-                    # Thêm chữ ký manager
-                    if user.has_personal_signature():
-                        leave_request.manager_signature = user.personal_signature
-                        leave_request.manager_signer_id = user.id
-                        leave_request.manager_approved_at = datetime.now()
-
-                    leave_request.status = 'pending_admin'
-                    leave_request.step = 'admin'
-                    leave_request.current_approver_id = None
-                    approved_count += 1
-
-                elif current_role == 'ADMIN':
-                    # ===== ADMIN BULK APPROVAL WITH BATCH GOOGLE SHEET UPDATE =====
-                    # Thay vì sync từng record, gom lại để batch update sau
-
-                    # Check Google API token một lần đầu tiên
-                    if len(admin_records_for_batch) == 0:
-                        token_status = check_google_token_status()
-                        if not token_status.get('can_approve', False):
-                            publish_token_status('expired', token_status.get('message', 'Token hết hạn'), needs_reauth=True)
-                            return jsonify({
-                                'error': f"⚠️ Token Google API hết hạn. {token_status.get('message', 'Vui lòng refresh token trước khi phê duyệt.')}",
-                                'error_code': 'token_expired',
-                                'needs_reauth': True
-                            }), 503
-
-                    # Store original status for rollback
-                    original_status = leave_request.status
-
-                    # Save signatures first
-                    if leave_request.status == 'pending' and user.has_personal_signature():
-                        leave_request.team_leader_signature = user.personal_signature
-                        leave_request.team_leader_signer_id = user.id
-
-                    if leave_request.status == 'pending_manager' and user.has_personal_signature():
-                        leave_request.manager_signature = user.personal_signature
-                        leave_request.manager_signer_id = user.id
+        if action == 'reject' or current_role != 'ADMIN':
+            # ===== TEAM_LEADER / MANAGER DUYỆT, HOẶC TỪ CHỐI: 1 UPDATE + 1 AUDIT MỖI LÔ =====
+            id_query = leave_requests_query.with_entities(LeaveRequest.id, LeaveRequest.status)
+            for rows in iter_keyset_chunks(id_query, LeaveRequest.id):
+                ids = [row.id for row in rows]
+                if action == 'reject':
+                    changed = bulk_update(LeaveRequest, ids, leave_reject_values(reason), *guards)
+                    new_values = {'status': 'rejected', 'reject_reason': reason}
+                    rejected_count += changed
+                else:
+                    changed = bulk_update(LeaveRequest, ids, leave_step_values(current_role, approver_id, signature, datetime.now()), *guards)
+                    new_values = {'status': 'pending_manager' if current_role == 'TEAM_LEADER' else 'pending_admin'}
+                    approved_count += changed
+                db.session.commit()
 
-                    # Add admin signature
-                    if user.has_personal_signature():
-                        leave_request.admin_signature = user.personal_signature
-                        leave_request.admin_signer_id = user.id
-                        leave_request.admin_approved_at = datetime.now()
+                log_bulk_audit(
+                    approver_id,
+                    'BULK_REJECT_LEAVE_REQUEST' if action == 'reject' else 'BULK_APPROVE_LEAVE_REQUEST',
+                    'leave_requests', ids, (row.status for row in rows), dict(new_values, updated=changed)
+                )
+                progress.advance(len(ids), 'update')
 
-                    # Lấy thông tin employee
+        else:
+            # ===== ADMIN BULK APPROVAL WITH BATCH GOOGLE SHEET UPDATE =====
+            # Check Google API token một lần trước khi bắt đầu
+            token_status = check_google_token_status()
+            if not token_status.get('can_approve', False):
+                publish_token_status('expired', token_status.get('message', 'Token hết hạn'), needs_reauth=True)
+                return jsonify({
+                    'error': f"⚠️ Token Google API hết hạn. {token_status.get('message', 'Vui lòng refresh token trước khi phê duyệt.')}",
+                    'error_code': 'token_expired',
+                    'needs_reauth': True
+                }), 503
+
+            # Bước 1: đọc theo lô, kiểm tra thông tin nhân viên và gom đơn hợp lệ để batch update.
+            # Đơn được giữ trong session vì batch update cần phân bổ ngày nghỉ từ chính object
+            admin_records_for_batch = []
+            employee_names = {}
+            chunk_query = leave_requests_query.options(joinedload(LeaveRequest.user))
+            for chunk in iter_keyset_chunks(chunk_query, LeaveRequest.id):
+                for leave_request in chunk:
+                    employee_names[leave_request.id] = leave_request.employee_name
                     employee = leave_request.user
-                    if not employee:
-                        employee = db.session.get(User, leave_request.user_id)
 
                     if not employee:
-                        google_sheet_errors.append({
-                            'id': leave_request.id,
-                            'employee_name': leave_request.employee_name,
-                            'error': 'Không tìm thấy thông tin nhân viên'
-                        })
-                        continue
-
-                    employee_team = employee.department
-                    employee_id = employee.employee_id
-
-                    if not employee_id:
-                        google_sheet_errors.append({
-                            'id': leave_request.id,
-                            'employee_name': leave_request.employee_name,
-                            'error': 'Nhân viên chưa có mã nhân viên (employee_id)'
-                        })
-                        continue
+                        error_msg = 'Không tìm thấy thông tin nhân viên'
+                    elif not employee.employee_id:
+                        error_msg = 'Nhân viên chưa có mã nhân viên (employee_id)'
+                    elif not employee.department or employee.department == "Unknown":
+                        error_msg = 'Nhân viên chưa cập nhật phòng ban (Department)'
+                    else:
+                        error_msg = None
 
-                    if not employee_team or employee_team == "Unknown":
+                    if error_msg:
                         google_sheet_errors.append({
                             'id': leave_request.id,
                             'employee_name': leave_request.employee_name,
-                            'error': 'Nhân viên chưa cập nhật phòng ban (Department)'
+                            'error': error_msg
                         })
                         continue
 
-                    # ===== GOM RECORD VÀO LIST ĐỂ BATCH UPDATE SAU =====
                     admin_records_for_batch.append({
                         'leave_request': leave_request,
-                        'employee_team': employee_team,
-                        'employee_id': employee_id,
+                        'employee_team': employee.department,
+                        'employee_id': employee.employee_id,
                         'leave_data': {},  # Sẽ được xử lý trong batch_update function
-                        'original_status': original_status
-                    })
-
-                    # Không tăng approved_count ở đây - sẽ xử lý sau khi batch update
-                    continue  # Skip to next record, batch update sẽ xử lý sau
-
-
-            elif action == 'reject':
-                # Từ chối đơn nghỉ phép
-                leave_request.status = 'rejected'
-                leave_request.reject_reason = reason
-                leave_request.step = 'done'
-                leave_request.current_approver_id = None
-                rejected_count += 1
-
-        # ===== BATCH UPDATE GOOGLE SHEETS FOR ADMIN RECORDS =====
-        if current_role == 'ADMIN' and action == 'approve' and admin_records_for_batch:
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            try:
-                print(f"\n{'='*80}", flush=True, file=sys.stderr)
-                print(f"🚀 [BATCH_LEAVE_UPDATE_START] {timestamp} - Bắt đầu BATCH UPDATE cho {len(admin_records_for_batch)} leave requests", flush=True, file=sys.stderr)
-                print(f"{'='*80}", flush=True, file=sys.stderr)
-            except Exception:
-                pass
-
-            # Gọi batch update
-            batch_result = batch_update_multi_leave_requests_sync(admin_records_for_batch)
-
-            # Xử lý kết quả batch update
-            for record in admin_records_for_batch:
-                leave_request = record['leave_request']
-                original_status = record['original_status']
-
-                if leave_request.id in batch_result['success_ids']:
-                    # Google Sheet thành công - mark as approved
-                    leave_request.status = 'approved'
-                    leave_request.step = 'done'
-                    leave_request.current_approver_id = None
-                    leave_request.google_sheet_synced = True
-                    leave_request.google_sheet_sync_at = datetime.now()
-                    leave_request.google_sheet_sync_error = None
-                    approved_leave_ids.append(leave_request.id)
-                    approved_count += 1
-                else:
-                    # Google Sheet thất bại - rollback status
-                    leave_request.status = original_status
-                    leave_request.google_sheet_synced = False
-
-                    # Tìm error message
-                    error_msg = 'Unknown error'
-                    for failed in batch_result['failed']:
-                        if failed['id'] == leave_request.id:
-                            error_msg = failed['error']
-                            break
-
-                    leave_request.google_sheet_sync_error = error_msg
-                    google_sheet_errors.append({
-                        'id': leave_request.id,
-                        'employee_name': leave_request.employee_name,
-                        'error': error_msg,
-                        'original_status': original_status
+                        'original_status': leave_request.status
                     })
+                progress.advance(len(chunk), 'prepare')
 
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            try:
-                print(f"\n{'='*80}", flush=True, file=sys.stderr)
-                print(f"📊 [BATCH_LEAVE_UPDATE_COMPLETE] {timestamp}", flush=True, file=sys.stderr)
-                print(f"   ✅ Thành công: {len(batch_result['success_ids'])} leave requests", flush=True, file=sys.stderr)
-                print(f"   ❌ Thất bại: {len(batch_result['failed'])} leave requests", flush=True, file=sys.stderr)
-                print(f"   📡 Tổng API calls: {batch_result['total_api_calls']} (thay vì {len(admin_records_for_batch)} async threads)", flush=True, file=sys.stderr)
-                print(f"{'='*80}", flush=True, file=sys.stderr)
-            except Exception:
-                pass
-
-        # ===== COMMIT DATABASE =====
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        try:
-            print(f"\n{'='*80}", flush=True, file=sys.stderr)
-            print(f"💾 [BULK_LEAVE_COMMIT] {timestamp} - Đang commit tất cả thay đổi...", flush=True, file=sys.stderr)
-            print(f"{'='*80}", flush=True, file=sys.stderr)
-        except Exception:
-            pass
+            # Bước 2: 1 lần gọi batch update cho tất cả đơn (gom theo spreadsheet / sheet nhân viên)
+            batch_result = {'success_ids': [], 'failed': [], 'total_api_calls': 0}
+            if admin_records_for_batch:
+                try:
+                    approval_log.debug("🚀 [BATCH_LEAVE_UPDATE_START] Bắt đầu BATCH UPDATE cho %s leave requests", len(admin_records_for_batch))
+                except Exception:
+                    pass
+                progress.publish('google_sheet')
+                batch_result = batch_update_multi_leave_requests_sync(admin_records_for_batch)
+            original_statuses = {record['leave_request'].id: record['original_status'] for record in admin_records_for_batch}
 
-        try:
+            # Bước 3: đơn cập nhật Google Sheet thành công -> approved (theo lô)
+            for ids in chunked(batch_result['success_ids']):
+                changed = bulk_update(LeaveRequest, ids, leave_final_values(approver_id, signature, datetime.now()), *guards)
+                db.session.commit()
+                approved_count += changed
+                approved_leave_ids.extend(ids)
+                log_bulk_audit(
+                    approver_id, 'BULK_APPROVE_LEAVE_REQUEST', 'leave_requests', ids,
+                    (original_statuses.get(leave_id, '') for leave_id in ids),
+                    {'status': 'approved', 'admin_signer_id': approver_id if signature else None, 'updated': changed}
+                )
+                progress.publish('update', approved=approved_count)
+
+            # Đơn thất bại giữ nguyên status để thử lại, chỉ ghi lại lỗi đồng bộ (gộp theo nội dung lỗi)
+            failed_by_error = {}
+            for failed in batch_result['failed']:
+                failed_by_error.setdefault(failed['error'], []).append(failed['id'])
+                google_sheet_errors.append({
+                    'id': failed['id'],
+                    'employee_name': employee_names.get(failed['id']),
+                    'error': failed['error'],
+                    'original_status': original_statuses.get(failed['id'])
+                })
+            for error_msg, failed_ids in failed_by_error.items():
+                for ids in chunked(failed_ids):
+                    bulk_update(LeaveRequest, ids, {'google_sheet_synced': False, 'google_sheet_sync_error': error_msg}, *guards)
             db.session.commit()
-            timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-            try:
-                print(f"✅ [BULK_LEAVE_COMMIT_SUCCESS] {timestamp} - Database đã được commit", flush=True, file=sys.stderr)
-            except Exception:
-                pass
-        except Exception as commit_error:
-            db.session.rollback()
+
             try:
-                print(f"❌ [BULK_LEAVE_COMMIT_ERROR] Lỗi commit: {str(commit_error)}", flush=True, file=sys.stderr)
+                approval_log.debug("📊 [BATCH_LEAVE_UPDATE_COMPLETE] ✅ %s / ❌ %s leave requests, 📡 %s API calls", len(batch_result['success_ids']), len(batch_result['failed']), batch_result['total_api_calls'])
             except Exception:
                 pass
-            return jsonify({'error': 'Lỗi lưu database'}), 500
 
         # ===== PREPARE RESPONSE WITH DETAILED SUMMARY =====
-        successful_approvals = len(approved_leave_ids) if current_role == 'ADMIN' else approved_count
         failed_approvals = len(google_sheet_errors)
-        total_processed = approved_count + rejected_count + failed_approvals # Include failed attempts in processed count? 
-        # Logic đếm: total_processed là tổng số record đã DUYỆT QUA. 
-        # Nếu fail, nó vẫn đã được xử lý (nhưng kết quả là fail/revert).
-        # Tuy nhiên biến approved_count chỉ tăng khi thành công.
-        
-        total_processed = len(leave_requests) # Tổng số request gửi lên/query được
+        total_processed = total  # Tổng số đơn query được (kể cả đơn thất bại)
 
-        
         # Build message
         message = f'Đã xử lý {total_processed} đơn nghỉ phép'
 
@@ -17165,21 +16405,13 @@ def approve_all_leave_requests():
             message += f': {approved_count} phê duyệt, {rejected_count} từ chối'
 
         # Log summary
-        timestamp = dt.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
         try:
-            print(f"\n{'='*80}", flush=True, file=sys.stderr)
-            print(f"📊 [BULK_LEAVE_SUMMARY] {timestamp}", flush=True, file=sys.stderr)
-            print(f"   Tổng số xử lý: {total_processed}", flush=True, file=sys.stderr)
-            print(f"   ✅ Phê duyệt thành công: {approved_count}", flush=True, file=sys.stderr)
-            if approved_leave_ids:
-                print(f"      IDs: {', '.join(map(str, approved_leave_ids))}", flush=True, file=sys.stderr)
-            if failed_approvals > 0:
-                print(f"   ⚠️ Thất bại (Google Sheet): {failed_approvals}", flush=True, file=sys.stderr)
-            print(f"   ❌ Từ chối: {rejected_count}", flush=True, file=sys.stderr)
-            print(f"{'='*80}\n", flush=True, file=sys.stderr)
+            approval_log.debug("📊 [BULK_LEAVE_SUMMARY] %s %s: %s đơn, ✅ %s phê duyệt, ❌ %s từ chối, ⚠️ %s thất bại", current_role, action, total_processed, approved_count, rejected_count, failed_approvals)
         except Exception:
             pass
-        
+
+        progress.done(approved=approved_count, rejected=rejected_count, failed=failed_approvals)
+
         return jsonify({
             'success': True,
             'message': message,
@@ -17193,7 +16425,7 @@ def approve_all_leave_requests():
         
     except Exception as e:
         db.session.rollback()
-        print(f"Error in bulk leave approval: {e}", flush=True, file=sys.stderr)
+        approval_log.error("Error in bulk leave approval: %s", e)
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Lỗi khi xử lý hàng loạt: {str(e)}'}), 500
@@ -17251,21 +16483,21 @@ def activate():
     activation = get_activation_record()
     
     # Log để debug
-    print(f"[ACTIVATE WEB] Request từ: {request.remote_addr}, User-Agent: {request.headers.get('User-Agent', 'Unknown')}")
-    print(f"[ACTIVATE WEB] Trạng thái hiện tại - is_activated: {activation.is_activated}, license_key trong DB: {activation.license_key}")
+    license_log.debug("[ACTIVATE WEB] Request từ: %s, User-Agent: %s", request.remote_addr, request.headers.get('User-Agent', 'Unknown'))
+    license_log.debug("[ACTIVATE WEB] Trạng thái hiện tại - is_activated: %s, license_key trong DB: %s", activation.is_activated, activation.license_key)
 
     # Nếu đã kích hoạt rồi thì chuyển về trang đăng nhập / dashboard
     if activation.is_activated:
         current_key = get_license_key()
-        print(f"[ACTIVATE WEB] Đã kích hoạt, key hiện tại: {current_key}")
+        license_log.debug("[ACTIVATE WEB] Đã kích hoạt, key hiện tại: %s", current_key)
         if 'user_id' in session:
             return redirect(url_for('dashboard'))
         return redirect(url_for('login'))
 
     if request.method == 'POST':
         input_key = (request.form.get('license_key') or '').strip()
-        print(f"[ACTIVATE WEB] Key nhận được từ form: {input_key[:10]}... (độ dài: {len(input_key)})")
-        print(f"[ACTIVATE WEB] Key chuẩn trên server (APP_LICENSE_KEY): {APP_LICENSE_KEY[:10]}... (độ dài: {len(APP_LICENSE_KEY)})")
+        license_log.debug("[ACTIVATE WEB] Key nhận được từ form: %s... (độ dài: %s)", input_key[:10], len(input_key))
+        license_log.debug("[ACTIVATE WEB] Key chuẩn trên server (APP_LICENSE_KEY): %s... (độ dài: %s)", APP_LICENSE_KEY[:10], len(APP_LICENSE_KEY))
         
         if not input_key:
             flash('Vui lòng nhập key kích hoạt!', 'error')
@@ -17278,15 +16510,16 @@ def activate():
             activation.activated_at = datetime.utcnow()
             try:
                 db.session.commit()
-                print(f"[ACTIVATE WEB] ✅ Kích hoạt thành công! Key đã lưu vào DB: {input_key[:10]}...")
+                activation_state.update(activation, reason='activate')
+                license_log.debug("[ACTIVATE WEB] ✅ Kích hoạt thành công! Key đã lưu vào DB: %s...", input_key[:10])
                 flash('Kích hoạt thành công! Bạn có thể đăng nhập và sử dụng hệ thống.', 'success')
                 return redirect(url_for('login'))
             except Exception as e:
                 db.session.rollback()
-                print(f"[ACTIVATE WEB] ❌ Lỗi lưu kích hoạt: {e}")
+                license_log.debug("[ACTIVATE WEB] ❌ Lỗi lưu kích hoạt: %s", e)
                 flash('Có lỗi khi lưu thông tin kích hoạt. Vui lòng thử lại.', 'error')
         else:
-            print(f"[ACTIVATE WEB] ❌ Key không hợp lệ! Input: {input_key[:10]}..., Expected: {APP_LICENSE_KEY[:10]}...")
+            license_log.debug("[ACTIVATE WEB] ❌ Key không hợp lệ! Input: %s..., Expected: %s...", input_key[:10], APP_LICENSE_KEY[:10])
             flash('Key kích hoạt không hợp lệ. Vui lòng kiểm tra lại.', 'error')
 
     return render_template('activate.html')
@@ -17302,13 +16535,13 @@ def api_activate():
         activation = get_activation_record()
         
         # Log để debug
-        print(f"[ACTIVATE API] Request từ: {request.remote_addr}, User-Agent: {request.headers.get('User-Agent', 'Unknown')}")
-        print(f"[ACTIVATE API] Trạng thái hiện tại - is_activated: {activation.is_activated}, license_key trong DB: {activation.license_key}")
+        license_log.debug("[ACTIVATE API] Request từ: %s, User-Agent: %s", request.remote_addr, request.headers.get('User-Agent', 'Unknown'))
+        license_log.debug("[ACTIVATE API] Trạng thái hiện tại - is_activated: %s, license_key trong DB: %s", activation.is_activated, activation.license_key)
 
         # Nếu đã kích hoạt rồi thì trả về thông báo
         if activation.is_activated:
             current_key = get_license_key()
-            print(f"[ACTIVATE API] Đã kích hoạt, key hiện tại: {current_key}")
+            license_log.debug("[ACTIVATE API] Đã kích hoạt, key hiện tại: %s", current_key)
             return jsonify({
                 'success': True,
                 'message': 'Ứng dụng đã được kích hoạt',
@@ -17324,8 +16557,8 @@ def api_activate():
         else:
             input_key = (request.form.get('license_key') or '').strip()
 
-        print(f"[ACTIVATE API] Key nhận được từ request: {input_key[:10]}... (độ dài: {len(input_key)})")
-        print(f"[ACTIVATE API] Key chuẩn trên server (APP_LICENSE_KEY): {APP_LICENSE_KEY[:10]}... (độ dài: {len(APP_LICENSE_KEY)})")
+        license_log.debug("[ACTIVATE API] Key nhận được từ request: %s... (độ dài: %s)", input_key[:10], len(input_key))
+        license_log.debug("[ACTIVATE API] Key chuẩn trên server (APP_LICENSE_KEY): %s... (độ dài: %s)", APP_LICENSE_KEY[:10], len(APP_LICENSE_KEY))
 
         if not input_key:
             return jsonify({
@@ -17340,7 +16573,8 @@ def api_activate():
             activation.activated_at = datetime.utcnow()
             try:
                 db.session.commit()
-                print(f"[ACTIVATE API] ✅ Kích hoạt thành công! Key đã lưu vào DB: {input_key[:10]}...")
+                activation_state.update(activation, reason='api_activate')
+                license_log.debug("[ACTIVATE API] ✅ Kích hoạt thành công! Key đã lưu vào DB: %s...", input_key[:10])
                 return jsonify({
                     'success': True,
                     'message': 'Kích hoạt thành công! Bạn có thể đăng nhập và sử dụng hệ thống.',
@@ -17349,13 +16583,13 @@ def api_activate():
                 })
             except Exception as e:
                 db.session.rollback()
-                print(f"[ACTIVATE API] ❌ Lỗi lưu kích hoạt: {e}")
+                license_log.debug("[ACTIVATE API] ❌ Lỗi lưu kích hoạt: %s", e)
                 return jsonify({
                     'success': False,
                     'error': 'Có lỗi khi lưu thông tin kích hoạt. Vui lòng thử lại.'
                 }), 500
         else:
-            print(f"[ACTIVATE API] ❌ Key không hợp lệ! Input: {input_key[:10]}..., Expected: {APP_LICENSE_KEY[:10]}...")
+            license_log.debug("[ACTIVATE API] ❌ Key không hợp lệ! Input: %s..., Expected: %s...", input_key[:10], APP_LICENSE_KEY[:10])
             return jsonify({
                 'success': False,
                 'error': 'Key kích hoạt không hợp lệ. Vui lòng kiểm tra lại.'
@@ -17671,12 +16905,8 @@ def submit_leave_request():
             # Gửi email thông báo đến HR (bất đồng bộ)
             try:
                 print(f"[Mail] Attempting to send create email for leave_request #{leave_request.id} by user #{user.id} ({user.name})")
+                # Xếp vào outbox; trạng thái 'sending' đã được ghi trước khi worker gửi
                 send_leave_request_email_async(leave_request, user, action='create')
-                # Process any pending DB updates from async threads
-                from utils.email_utils import process_db_updates
-                process_db_updates()
-                # Persist 'sending' immediately
-                upsert_email_status(leave_request.id, 'sending', 'Đang gửi email thông báo...')
                 # Lưu trạng thái email vào session cho tất cả vai trò
                 session['email_status'] = {
                     'request_id': leave_request.id,
@@ -17947,7 +17177,7 @@ def leave_requests_list():
             # TEAM_LEADER chỉ thấy đơn pending (chưa được phê duyệt) của cùng phòng ban
             query = query.filter(
                 LeaveRequest.status == 'pending',
-                LeaveRequest.user.has(User.department == user.department)
+                LeaveRequest.user_id.in_(User.team_ids(user.department))
             )
         elif current_role == 'MANAGER':
             # MANAGER chỉ thấy đơn pending_manager (đã được TEAM_LEADER phê duyệt)
@@ -18140,20 +17370,9 @@ def get_latest_email_status():
     return jsonify(sess)
 
 # ===================== SSE: Email Status Push =====================
-# In-memory subscribers per user_id
-_email_sse_subscribers = defaultdict(list)
-
-def _sse_subscribe(user_id: int) -> Queue:
-    q = Queue()
-    _email_sse_subscribers[user_id].append(q)
-    return q
-
-def _sse_unsubscribe(user_id: int, q: Queue) -> None:
-    try:
-        if q in _email_sse_subscribers.get(user_id, []):
-            _email_sse_subscribers[user_id].remove(q)
-    except Exception:
-        pass
+# Subscriber theo kênh "email:<user_id>" trên sse_broker (memory:// hoặc Redis dùng chung giữa các worker)
+def _email_sse_channel(user_id: int) -> str:
+    return email_status_channel(user_id)
 
 def publish_email_status(user_id: int, request_id: int, status: str, message: str) -> None:
     """Publish an email status event to all live SSE subscribers of the user."""
@@ -18162,45 +17381,36 @@ def publish_email_status(user_id: int, request_id: int, status: str, message: st
         'status': status,
         'message': message,
     }
-    for q in list(_email_sse_subscribers.get(user_id, [])):
-        try:
-            q.put_nowait(payload)
-        except Exception:
-            # if queue full/broken, ignore
-            pass
+    try:
+        sse_broker.publish(_email_sse_channel(user_id), payload)
+    except Exception as e:
+        print(f"⚠️ [SSE] Không publish được trạng thái email: {e}")
 
 @app.route('/sse/email-status')
 def sse_email_status():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    user_id = session['user_id']
-    q = _sse_subscribe(user_id)
+    # Chờ tin trên subscription (không poll); keep-alive mỗi 15s khi không có tin
+    stream = iter_sse_stream(sse_broker, _email_sse_channel(session['user_id']), 'email_status',
+                             keepalive=15, retry_ms=3000)
 
-    def stream():
-        # advise client reconnection delay
-        yield 'retry: 3000\n\n'
-        try:
-            # send a heartbeat every 15s if idle
-            last = time_module.time()
-            while True:
-                try:
-                    item = q.get(timeout=1.0)
-                    import json as _json
-                    data = _json.dumps(item, ensure_ascii=False)
-                    yield f"event: email_status\ndata: {data}\n\n"
-                    last = time_module.time()
-                except Exception:
-                    now = time_module.time()
-                    if now - last > 15:
-                        # comment heartbeat to keep connection alive
-                        yield ": keep-alive\n\n"
-                        last = now
-        finally:
-            _sse_unsubscribe(user_id, q)
+    from flask import Response
+    return Response(stream, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/sse/bulk-approval')
+def sse_bulk_approval():
+    """Tiến độ phê duyệt hàng loạt (approve-all) của user hiện tại - xem utils/bulk_approval.py"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    from utils.bulk_approval import bulk_approval_channel
+
+    stream = iter_sse_stream(sse_broker, bulk_approval_channel(session['user_id']), 'bulk_approval',
+                             keepalive=15, retry_ms=3000)
 
     from flask import Response
-    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return Response(stream, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/test-email-status')
 def test_email_status():
@@ -18234,8 +17444,8 @@ def set_test_email_status(request_id):
     })
 
 # ===================== SSE: Token Status Push =====================
-# In-memory subscribers for token status (admin only)
-_token_sse_subscribers = defaultdict(list)
+# Mọi client /sse/token-status nghe chung 1 kênh trên sse_broker
+_TOKEN_SSE_CHANNEL = 'token_status'
 # Global token status flag
 _token_status = {
     'valid': True,
@@ -18253,18 +17463,6 @@ _license_warning_state = {
 }
 _license_warning_lock = threading.Lock()
 
-def _sse_token_subscribe(user_id: int) -> Queue:
-    q = Queue()
-    _token_sse_subscribers[user_id].append(q)
-    return q
-
-def _sse_token_unsubscribe(user_id: int, q: Queue) -> None:
-    try:
-        if q in _token_sse_subscribers.get(user_id, []):
-            _token_sse_subscribers[user_id].remove(q)
-    except Exception:
-        pass
-
 def publish_token_status(status: str, message: str, needs_reauth: bool = False) -> None:
     """Publish token status event to all admin SSE subscribers."""
     global _token_status
@@ -18298,13 +17496,11 @@ def publish_token_status(status: str, message: str, needs_reauth: bool = False)
         'timestamp': time_module.time()
     }
     
-    # Broadcast to all admin subscribers
-    for user_id, queues in list(_token_sse_subscribers.items()):
-        for q in list(queues):
-            try:
-                q.put_nowait(payload)
-            except Exception:
-                pass
+    # Broadcast to all admin subscribers (mọi worker nếu broker là Redis)
+    try:
+        sse_broker.publish(_TOKEN_SSE_CHANNEL, payload)
+    except Exception as e:
+        print(f"⚠️ [SSE] Không publish được trạng thái token: {e}")
     
     print(f"🔔 [Token Status] Published: {status} - {message}")
 
@@ -18428,34 +17624,12 @@ def sse_token_status():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    user_id = session['user_id']
-    q = _sse_token_subscribe(user_id)
-    
-    def stream():
-        yield 'retry: 5000\n\n'
-        try:
-            last = time_module.time()
-            # Send initial status
-            initial_status = check_google_token_status()
-            import json as _json
-            yield f"event: token_status\ndata: {_json.dumps(initial_status, ensure_ascii=False)}\n\n"
-            
-            while True:
-                try:
-                    item = q.get(timeout=1.0)
-                    data = _json.dumps(item, ensure_ascii=False)
-                    yield f"event: token_status\ndata: {data}\n\n"
-                    last = time_module.time()
-                except Exception:
-                    now = time_module.time()
-                    if now - last > 30:
-                        yield ": keep-alive\n\n"
-                        last = now
-        finally:
-            _sse_token_unsubscribe(user_id, q)
-    
+    # Send initial status, sau đó chờ tin trên subscription; keep-alive mỗi 30s
+    stream = iter_sse_stream(sse_broker, _TOKEN_SSE_CHANNEL, 'token_status', keepalive=30, retry_ms=5000,
+                             initial=check_google_token_status())
+
     from flask import Response
-    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return Response(stream, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/api/license/warning-status')
@@ -18549,8 +17723,9 @@ def api_license_update_db_key():
             activation.is_activated = False
             activation.activated_at = None
             db.session.commit()
+            activation_state.update(activation, reason='update_db_key')
             
-            print(f"[LICENSE ADMIN] Admin {user.username} đã xóa key cũ: {old_key}")
+            license_log.debug("[LICENSE ADMIN] Admin %s đã xóa key cũ: %s", user.username, old_key)
             
             return jsonify({
                 'success': True,
@@ -18566,8 +17741,9 @@ def api_license_update_db_key():
             activation.is_activated = True
             activation.activated_at = datetime.utcnow()
             db.session.commit()
+            activation_state.update(activation, reason='update_db_key')
             
-            print(f"[LICENSE ADMIN] Admin {user.username} đã set key mới: {new_key} (key cũ: {old_key})")
+            license_log.debug("[LICENSE ADMIN] Admin %s đã set key mới: %s (key cũ: %s)", user.username, new_key, old_key)
             
             return jsonify({
                 'success': True,
@@ -18586,8 +17762,9 @@ def api_license_update_db_key():
                 activation.is_activated = True
                 activation.activated_at = datetime.utcnow()
                 db.session.commit()
+                activation_state.update(activation, reason='update_db_key')
                 
-                print(f"[LICENSE ADMIN] Admin {user.username} đã đồng bộ key từ env: {env_key} (key cũ: {old_key})")
+                license_log.debug("[LICENSE ADMIN] Admin %s đã đồng bộ key từ env: %s (key cũ: %s)", user.username, env_key, old_key)
                 
                 return jsonify({
                     'success': True,
@@ -18611,7 +17788,7 @@ def api_license_update_db_key():
             
     except Exception as e:
         db.session.rollback()
-        print(f"[LICENSE ADMIN] Lỗi: {e}")
+        license_log.debug("[LICENSE ADMIN] Lỗi: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -19197,9 +18374,6 @@ def edit_leave_request(request_id):
                 try:
                     print(f"[Mail] Attempting to send update email for leave_request #{leave_request.id} by user #{user.id} ({user.name})")
                     send_leave_request_email_async(leave_request, user, action='update')
-                    # Process any pending DB updates from async threads
-                    from utils.email_utils import process_db_updates
-                    process_db_updates()
                     # Lưu trạng thái email vào session cho tất cả vai trò
                     session['email_status'] = {
                         'request_id': leave_request.id,
@@ -19312,12 +18486,12 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
     import sys
     from datetime import datetime as dt
 
-    _safe_print(f"🔄 [SCHEDULE_LEAVE_SHEET] Bắt đầu xử lý đơn #{leave_request.id if leave_request else 'None'}")
+    sheets_log.debug("🔄 [SCHEDULE_LEAVE_SHEET] Bắt đầu xử lý đơn #%s", (leave_request.id if leave_request else 'None'))
 
     try:
         # Không có đơn nghỉ thì dừng
         if not leave_request:
-            _safe_print(f"⚠️ [SCHEDULE_LEAVE_SHEET] Không có đơn nghỉ phép")
+            sheets_log.warning("⚠️ [SCHEDULE_LEAVE_SHEET] Không có đơn nghỉ phép")
             return
 
         # Xử lý riêng cho đơn nghỉ 30 phút: chỉ đẩy memo vào cột P
@@ -19361,9 +18535,9 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
             }
 
             try:
-                _safe_print(f"📌 [SCHEDULE_LEAVE_SHEET] Đơn nghỉ 30 phút -> chỉ cập nhật cột P")
-                _safe_print(f"   Ngày: {leave_date.isoformat()}")
-                _safe_print(f"   Memo: {summary_text}")
+                sheets_log.debug("📌 [SCHEDULE_LEAVE_SHEET] Đơn nghỉ 30 phút -> chỉ cập nhật cột P")
+                sheets_log.debug("   Ngày: %s", leave_date.isoformat())
+                sheets_log.debug("   Memo: %s", summary_text)
             except Exception:
                 pass
 
@@ -19376,7 +18550,7 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
                 )
             except Exception as memo_err:
                 try:
-                    _safe_print(f"❌ [SCHEDULE_LEAVE_SHEET] Lỗi khi cập nhật memo nghỉ 30 phút: {memo_err}")
+                    sheets_log.error("❌ [SCHEDULE_LEAVE_SHEET] Lỗi khi cập nhật memo nghỉ 30 phút: %s", memo_err)
                 except Exception:
                     pass
 
@@ -19437,11 +18611,11 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
             }
 
             try:
-                _safe_print(f"📌 [SCHEDULE_LEAVE_SHEET] Đơn đi trễ/về sớm -> cập nhật cột P và trừ giờ")
-                _safe_print(f"   Ngày: {leave_date.isoformat()}")
-                _safe_print(f"   Loại: {late_early_type}")
-                _safe_print(f"   Memo: {summary_text}")
-                _safe_print(f"   Số phút: {late_early_minutes}")
+                sheets_log.debug("📌 [SCHEDULE_LEAVE_SHEET] Đơn đi trễ/về sớm -> cập nhật cột P và trừ giờ")
+                sheets_log.debug("   Ngày: %s", leave_date.isoformat())
+                sheets_log.debug("   Loại: %s", late_early_type)
+                sheets_log.debug("   Memo: %s", summary_text)
+                sheets_log.debug("   Số phút: %s", late_early_minutes)
             except Exception:
                 pass
 
@@ -19454,37 +18628,37 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
                 )
             except Exception as late_early_err:
                 try:
-                    _safe_print(f"❌ [SCHEDULE_LEAVE_SHEET] Lỗi khi cập nhật đơn đi trễ/về sớm: {late_early_err}")
+                    sheets_log.error("❌ [SCHEDULE_LEAVE_SHEET] Lỗi khi cập nhật đơn đi trễ/về sớm: %s", late_early_err)
                 except Exception:
                     pass
 
         # Các loại khác ngoài 'leave', '30min_break' và 'late_early' thì không xử lý
         if leave_request.request_type != 'leave':
-            _safe_print(f"⚠️ [SCHEDULE_LEAVE_SHEET] Không phải đơn nghỉ phép (type: {leave_request.request_type})")
+            sheets_log.warning("⚠️ [SCHEDULE_LEAVE_SHEET] Không phải đơn nghỉ phép (type: %s)", leave_request.request_type)
             return
 
         # Dùng cùng logic phân bổ ngày như Excel export để mỗi ngày có đúng số ngày nghỉ
         try:
-            _safe_print(f"📊 [SCHEDULE_LEAVE_SHEET] Đang phân bổ ngày nghỉ...")
+            sheets_log.debug("📊 [SCHEDULE_LEAVE_SHEET] Đang phân bổ ngày nghỉ...")
 
             from utils.excel_leave_processor import process_leave_requests_for_excel
             daily_leaves = process_leave_requests_for_excel([leave_request])
 
-            _safe_print(f"✅ [SCHEDULE_LEAVE_SHEET] Phân bổ thành công: {len(daily_leaves)} ngày")
+            sheets_log.info("✅ [SCHEDULE_LEAVE_SHEET] Phân bổ thành công: %s ngày", len(daily_leaves))
         except Exception as alloc_err:
             import traceback
-            _safe_print(f"❌ [SCHEDULE_LEAVE_SHEET] Lỗi phân bổ ngày nghỉ: {alloc_err}")
-            _safe_print(traceback.format_exc())
+            sheets_log.error("❌ [SCHEDULE_LEAVE_SHEET] Lỗi phân bổ ngày nghỉ: %s", alloc_err)
+            sheets_log.error("%s", traceback.format_exc())
             daily_leaves = []
 
         if not daily_leaves:
-            _safe_print(f"⚠️ [SCHEDULE_LEAVE_SHEET] Không có dữ liệu daily_leaves cho đơn #{leave_request.id}")
+            sheets_log.warning("⚠️ [SCHEDULE_LEAVE_SHEET] Không có dữ liệu daily_leaves cho đơn #%s", leave_request.id)
             return
 
         employee = leave_request.user or db.session.get(User, leave_request.user_id)
 
         if not employee or not employee.employee_id:
-            _safe_print(f"⚠️ [SCHEDULE_LEAVE_SHEET] Thiếu thông tin nhân viên cho đơn #{leave_request.id}")
+            sheets_log.warning("⚠️ [SCHEDULE_LEAVE_SHEET] Thiếu thông tin nhân viên cho đơn #%s", leave_request.id)
             return
 
         employee_team = employee.department or leave_request.team or "Unknown"
@@ -19495,7 +18669,7 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
 
         def _worker():
             import sys
-            _safe_print(f"🚀 [LEAVE_SHEET_UPDATE] Xử lý {len(daily_leaves)} ngày nghỉ cho đơn #{leave_request.id}")
+            sheets_log.debug("🚀 [LEAVE_SHEET_UPDATE] Xử lý %s ngày nghỉ cho đơn #%s", len(daily_leaves), leave_request.id)
             
             # Tạo thread riêng cho mỗi ngày để chạy song song (parallel)
             threads = []
@@ -19565,9 +18739,9 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
                             employee_id=employee_id,
                             attendance_data=attendance_data
                         )
-                        _safe_print(f"✅ [LEAVE_SHEET_UPDATE] Hoàn thành ngày {day_idx}/{len(daily_leaves)}")
+                        sheets_log.info("✅ [LEAVE_SHEET_UPDATE] Hoàn thành ngày %s/%s", day_idx, len(daily_leaves))
                     except Exception as func_err:
-                        _safe_print(f"❌ [LEAVE_SHEET_UPDATE] Lỗi ngày {day_idx}: {func_err}")
+                        sheets_log.error("❌ [LEAVE_SHEET_UPDATE] Lỗi ngày %s: %s", day_idx, func_err)
                 
                 # Tạo thread cho ngày này và chạy ngay lập tức
                 thread = threading.Thread(
@@ -19579,21 +18753,21 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
                 threads.append(thread)
             
             # Không chờ các thread - để chúng chạy song song trong background
-            _safe_print(f"✅ [LEAVE_SHEET_UPDATE] Đã khởi động {len(threads)} thread song song")
+            sheets_log.info("✅ [LEAVE_SHEET_UPDATE] Đã khởi động %s thread song song", len(threads))
 
         threading.Thread(target=_worker, daemon=True).start()
-        _safe_print(f"✅ [SCHEDULE_LEAVE_SHEET] Đã khởi động background thread")
+        sheets_log.info("✅ [SCHEDULE_LEAVE_SHEET] Đã khởi động background thread")
             
     except Exception as sheet_error:
         import traceback
-        _safe_print(f"❌ [SCHEDULE_LEAVE_SHEET] Lỗi: {sheet_error}")
-        _safe_print(traceback.format_exc())
+        sheets_log.error("❌ [SCHEDULE_LEAVE_SHEET] Lỗi: %s", sheet_error)
+        sheets_log.error("%s", traceback.format_exc())
             
         # --- ROLLBACK LOGIC ---
         # Nếu có lỗi nghiêm trọng khiến không thể chạy worker, cần rollback trạng thái về pending_admin
         if leave_request:
             try:
-                _safe_print(f"🔄 [ROLLBACK] Đang hoàn tác trạng thái đơn #{leave_request.id} về 'pending_admin'...")
+                sheets_log.debug("🔄 [ROLLBACK] Đang hoàn tác trạng thái đơn #%s về 'pending_admin'...", leave_request.id)
 
                 # Cần tạo app context mới để rollback vì đang ở thread khác/context cũ có thể đã đóng
                 with app.app_context():
@@ -19613,9 +18787,9 @@ def schedule_leave_sheet_updates(leave_request, approver=None):
                         lr_to_rollback.notes = current_notes + error_note
 
                         db.session.commit()
-                        _safe_print(f"✅ [ROLLBACK] Hoàn tất. Admin cần duyệt lại đơn nảy.")
+                        sheets_log.info("✅ [ROLLBACK] Hoàn tất. Admin cần duyệt lại đơn nảy.")
             except Exception as rollback_err:
-                _safe_print(f"❌ [ROLLBACK_FAILED] Lỗi khi rollback: {rollback_err}")
+                sheets_log.error("❌ [ROLLBACK_FAILED] Lỗi khi rollback: %s", rollback_err)
 
 
 def trigger_schedule_leave_sheet_updates_async(leave_request_id, approver_id=None):
@@ -19625,12 +18799,12 @@ def trigger_schedule_leave_sheet_updates_async(leave_request_id, approver_id=Non
         sync_error_msg = None
 
         try:
-            _safe_print(f"🧵 [LEAVE_SHEET_ASYNC] Thread bắt đầu cho đơn #{leave_request_id}")
+            sheets_log.debug("🧵 [LEAVE_SHEET_ASYNC] Thread bắt đầu cho đơn #%s", leave_request_id)
             with app.app_context():
                 lr = db.session.get(LeaveRequest, leave_request_id)
                 approver = db.session.get(User, approver_id) if approver_id else None
                 if not lr:
-                    _safe_print(f"⚠️ [LEAVE_SHEET_ASYNC] Không tìm thấy đơn #{leave_request_id}")
+                    sheets_log.warning("⚠️ [LEAVE_SHEET_ASYNC] Không tìm thấy đơn #%s", leave_request_id)
                     return
 
                 # Tăng số lần thử sync
@@ -19648,8 +18822,8 @@ def trigger_schedule_leave_sheet_updates_async(leave_request_id, approver_id=Non
             db.session.rollback()  # Rollback transaction on error
             try:
                 import traceback
-                _safe_print(f"❌ [LEAVE_SHEET_ASYNC] Lỗi khi chạy background cho đơn #{leave_request_id}: {async_err}")
-                _safe_print(traceback.format_exc())
+                sheets_log.error("❌ [LEAVE_SHEET_ASYNC] Lỗi khi chạy background cho đơn #%s: %s", leave_request_id, async_err)
+                sheets_log.error("%s", traceback.format_exc())
             except Exception:
                 pass
         finally:
@@ -19659,22 +18833,25 @@ def trigger_schedule_leave_sheet_updates_async(leave_request_id, approver_id=Non
                     lr = db.session.get(LeaveRequest, leave_request_id)
                     if lr:
                         from datetime import datetime as dt
-                        if sync_success:
+                        if sync_success and sheet_sync_outbox.has_tasks(leave_request_id):
+                            # Việc đã vào outbox: google_sheet_* do worker cập nhật khi ghi sheet xong / lỗi
+                            sheets_log.debug("📥 [LEAVE_SHEET_ASYNC] Đơn #%s đã vào outbox, chờ worker ghi sheet", leave_request_id)
+                        elif sync_success:
                             lr.google_sheet_synced = True
                             lr.google_sheet_sync_at = dt.now()
                             lr.google_sheet_sync_error = None
-                            _safe_print(f"✅ [LEAVE_SHEET_ASYNC] Đã đánh dấu đơn #{leave_request_id} là đã sync thành công")
+                            sheets_log.info("✅ [LEAVE_SHEET_ASYNC] Đã đánh dấu đơn #%s là đã sync thành công", leave_request_id)
                         else:
                             lr.google_sheet_synced = False
                             lr.google_sheet_sync_error = sync_error_msg or "Unknown error"
-                            _safe_print(f"❌ [LEAVE_SHEET_ASYNC] Đã đánh dấu đơn #{leave_request_id} là sync thất bại: {sync_error_msg}")
+                            sheets_log.error("❌ [LEAVE_SHEET_ASYNC] Đã đánh dấu đơn #%s là sync thất bại: %s", leave_request_id, sync_error_msg)
                         db.session.commit()
             except Exception as db_err:
                 db.session.rollback()  # Rollback transaction on error
-                _safe_print(f"⚠️ [LEAVE_SHEET_ASYNC] Lỗi khi cập nhật trạng thái sync: {db_err}")
+                sheets_log.warning("⚠️ [LEAVE_SHEET_ASYNC] Lỗi khi cập nhật trạng thái sync: %s", db_err)
 
             try:
-                _safe_print(f"🧵 [LEAVE_SHEET_ASYNC] Thread kết thúc cho đơn #{leave_request_id}")
+                sheets_log.debug("🧵 [LEAVE_SHEET_ASYNC] Thread kết thúc cho đơn #%s", leave_request_id)
             except Exception:
                 pass
 
@@ -19686,9 +18863,8 @@ def trigger_schedule_leave_sheet_updates_async(leave_request_id, approver_id=Non
 def approve_leave_request(request_id):
     """Phê duyệt hoặc từ chối đơn xin nghỉ phép - Logic đa cấp đồng bộ với chấm công"""
     import sys
-    from datetime import datetime as dt
 
-    _safe_print(f"🚀 [LEAVE_APPROVE] Bắt đầu xử lý đơn #{request_id}")
+    approval_log.debug("🚀 [LEAVE_APPROVE] Bắt đầu xử lý đơn #%s", request_id)
     
     if 'user_id' not in session:
         return jsonify({'error': 'Vui lòng đăng nhập để sử dụng chức năng này'}), 401
@@ -19701,31 +18877,31 @@ def approve_leave_request(request_id):
     user_roles = user.get_roles_list()
     current_role = session.get('current_role', user_roles[0] if user_roles else 'EMPLOYEE')
 
-    _safe_print(f"   👤 User: {user.name}, Role: {current_role}")
+    approval_log.debug("   👤 User: %s, Role: %s", user.name, current_role)
     
     if current_role not in ['ADMIN', 'MANAGER', 'TEAM_LEADER']:
-        _safe_print(f"❌ [LEAVE_APPROVE] User không có quyền phê duyệt (role: {current_role})")
+        approval_log.error("❌ [LEAVE_APPROVE] User không có quyền phê duyệt (role: %s)", current_role)
         abort(403)
     
     # Kiểm tra quyền phê duyệt
     has_permission, error_message = check_leave_approval_permission(user.id, request_id, current_role)
     if not has_permission:
-        _safe_print(f"❌ [LEAVE_APPROVE] Không có quyền phê duyệt: {error_message}")
+        approval_log.error("❌ [LEAVE_APPROVE] Không có quyền phê duyệt: %s", error_message)
         return jsonify({'error': error_message}), 403
 
     leave_request = LeaveRequest.query.get(request_id)
     if not leave_request:
-        _safe_print(f"❌ [LEAVE_APPROVE] Leave request {request_id} not found")
+        approval_log.error("❌ [LEAVE_APPROVE] Leave request %s not found", request_id)
         return jsonify({'error': 'Không tìm thấy đơn nghỉ phép'}), 404
 
     action = request.form.get('action')
     reason = request.form.get('rejection_reason', '')
     csrf_token = request.form.get('csrf_token')
 
-    _safe_print(f"   📝 Action: {action}, Status: {leave_request.status}")
+    approval_log.debug("   📝 Action: %s, Status: %s", action, leave_request.status)
     
     if not action:
-        _safe_print(f"❌ [LEAVE_APPROVE] No action provided for request {request_id}")
+        approval_log.error("❌ [LEAVE_APPROVE] No action provided for request %s", request_id)
         return jsonify({'error': 'Không có hành động được chỉ định'}), 400
 
     try:
@@ -19814,7 +18990,7 @@ def approve_leave_request(request_id):
                     validation_errors.append('User không có employee_id trong hệ thống')
 
                 if validation_errors:
-                    _safe_print(f"❌ [LEAVE_APPROVE] Validation failed cho đơn #{request_id}: {validation_errors}")
+                    approval_log.error("❌ [LEAVE_APPROVE] Validation failed cho đơn #%s: %s", request_id, validation_errors)
                     return jsonify({
                         'error': 'Không thể phê duyệt do thiếu thông tin',
                         'validation_errors': validation_errors,
@@ -19855,24 +19031,24 @@ def approve_leave_request(request_id):
                 # Refresh leave_request từ database sau khi commit để đảm bảo có dữ liệu mới nhất
                 db.session.refresh(leave_request)
 
-                _safe_print(f"📋 [LEAVE_APPROVAL] Admin {user.name} phê duyệt đơn #{leave_request.id} - {leave_request.employee_name}")
+                approval_log.debug("📋 [LEAVE_APPROVAL] Admin %s phê duyệt đơn #%s - %s", user.name, leave_request.id, leave_request.employee_name)
 
                 trigger_schedule_leave_sheet_updates_async(leave_request.id, user.id if user else None)
 
-                _safe_print(f"✅ [LEAVE_APPROVAL] Đã khởi động background cập nhật Google Sheet cho đơn #{leave_request.id}")
+                approval_log.info("✅ [LEAVE_APPROVAL] Đã khởi động background cập nhật Google Sheet cho đơn #%s", leave_request.id)
             except Exception as sheet_err:
                 import traceback
-                _safe_print(f"❌ [LEAVE_APPROVAL] Lỗi Google Sheet cho đơn #{leave_request.id}: {sheet_err}")
-                _safe_print(traceback.format_exc())
+                approval_log.error("❌ [LEAVE_APPROVAL] Lỗi Google Sheet cho đơn #%s: %s", leave_request.id, sheet_err)
+                approval_log.error("%s", traceback.format_exc())
 
-        _safe_print(f"✅ [LEAVE_APPROVE] Hoàn thành đơn #{request_id}: {message}")
+        approval_log.info("✅ [LEAVE_APPROVE] Hoàn thành đơn #%s: %s", request_id, message)
         return jsonify({'message': message})
 
     except Exception as e:
         db.session.rollback()
         import traceback
-        _safe_print(f"❌ [LEAVE_APPROVE] Lỗi đơn #{request_id}: {e}")
-        _safe_print(traceback.format_exc())
+        approval_log.error("❌ [LEAVE_APPROVE] Lỗi đơn #%s: %s", request_id, e)
+        approval_log.error("%s", traceback.format_exc())
         return jsonify({'error': f'Lỗi khi xử lý đơn xin nghỉ phép: {str(e)}'}), 500
 
 @app.route('/leave-request/<int:request_id>/delete')
@@ -19903,9 +19079,6 @@ def delete_leave_request(request_id):
         try:
             # Gửi email thông báo tới HR về việc người dùng hủy/xóa đơn
             send_leave_request_email_async(leave_request, user, action='delete')
-            from utils.email_utils import process_db_updates
-            process_db_updates()
-            upsert_email_status(leave_request.id, 'sending', 'Đang gửi email thông báo hủy/xóa đơn...')
             session['email_status'] = {
                 'request_id': leave_request.id,
                 'status': 'sending',
@@ -20155,10 +19328,10 @@ def api_chatbot():
                         current_role = user_roles[0]
                     user_context['role'] = current_role or None
         except Exception as e:
-            print(f"[CHATBOT] Lỗi lấy context người dùng: {e}")
+            chatbot_log.debug("[CHATBOT] Lỗi lấy context người dùng: %s", e)
 
         try:
-            print(f"[CHATBOT] /api/chatbot called by user_id={session.get('user_id')} role={session.get('current_role')}, history_length={len(conversation_history)}, ui_context_keys={list(ui_context.keys())}")
+            chatbot_log.debug("[CHATBOT] /api/chatbot called by user_id=%s role=%s, history_length=%s, ui_context_keys=%s", session.get('user_id'), session.get('current_role'), len(conversation_history), list(ui_context.keys()))
         except Exception:
             pass
 
@@ -20166,7 +19339,7 @@ def api_chatbot():
         return jsonify({'answer': answer})
 
     except Exception as e:
-        print(f"[CHATBOT] Lỗi trong api_chatbot: {e}")
+        chatbot_log.debug("[CHATBOT] Lỗi trong api_chatbot: %s", e)
         return jsonify({'error': 'Có lỗi xảy ra khi gọi trợ lý AI. Vui lòng thử lại sau.'}), 500
 
 
@@ -20192,14 +19365,11 @@ def api_pending_leave_count():
         
         if current_role == 'TEAM_LEADER':
             # TEAM_LEADER chỉ đếm đơn pending của nhân viên cùng phòng ban
-            pending_count = LeaveRequest.query.filter(
-                LeaveRequest.status == 'pending',
-                LeaveRequest.user.has(User.department == user.department)
-            ).count()
+            pending_count = pending_counters.count(PENDING_LEAVE, 'pending', user.department)
         elif current_role == 'MANAGER':
-            pending_count = LeaveRequest.query.filter_by(status='pending_manager').count()
+            pending_count = pending_counters.count(PENDING_LEAVE, 'pending_manager')
         elif current_role == 'ADMIN':
-            pending_count = LeaveRequest.query.filter_by(status='pending_admin').count()
+            pending_count = pending_counters.count(PENDING_LEAVE, 'pending_admin')
         else:
             pending_count = 0
         
@@ -20258,9 +19428,8 @@ def export_leave_history_excel():
     """Xuất lịch sử nghỉ phép ra file Excel cho ADMIN - Tách từng ngày riêng biệt"""
     try:
         # Import utility functions
-        from utils.excel_leave_processor import process_leave_requests_for_excel
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
+        from utils.excel_leave_processor import iter_leave_requests_for_excel
+        from utils.excel_stream_export import StreamingXlsxWriter, iter_query_in_chunks
         
         # Lấy dữ liệu theo bộ lọc giống trang danh sách
         if 'user_id' not in session:
@@ -20331,22 +19500,11 @@ def export_leave_history_excel():
         except Exception:
             pass
 
-        leave_requests = query.order_by(LeaveRequest.created_at.desc()).all()
+        # Đọc đơn nghỉ theo từng lô và tách từng ngày ngay khi đọc (không giữ toàn bộ trong RAM)
+        report = report_session_for_request()
+        leave_query = query.with_session(report.session).order_by(LeaveRequest.created_at.desc())
+        daily_leaves = iter_leave_requests_for_excel(iter_query_in_chunks(leave_query))
 
-        # Xử lý dữ liệu để tách từng ngày
-        daily_leaves = process_leave_requests_for_excel(leave_requests)
-
-        # Tạo file Excel
-        wb = Workbook()
-        ws = wb.active
-        # Đặt tiêu đề sheet tiếng Việt (<=31 ký tự, không chứa: : \\ / ? * [ ])
-        ws.title = "Lịch sử nghỉ phép"
-        
-        # Định dạng header
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
-        
         # Tạo header mới với thông tin chi tiết hơn
         headers = [
             "Ngày nghỉ", 
@@ -20356,39 +19514,31 @@ def export_leave_history_excel():
             "Loại nghỉ", 
             "Số ngày"
         ]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-        
-        # (Đã chuyển xuống cuối hàm để đảm bảo không bị ghi đè)
+        # Độ rộng cột: Ngày nghỉ, Tên nhân viên, Mã nhân viên, Thời gian nghỉ, Loại nghỉ, Số ngày
+        column_widths = [15, 40, 17, 25, 40, 12]
+        row_styles = ['export_center', 'export_left', 'export_center', 'export_center',
+                      'export_center_wrap', 'export_center']
+        # Đặt tiêu đề sheet tiếng Việt (<=31 ký tự, không chứa: : \\ / ? * [ ])
+        writer = StreamingXlsxWriter("Lịch sử nghỉ phép", headers, column_widths,
+                                     header_style='export_header_navy', row_height=30)
 
         # Thêm dữ liệu đã được tách theo ngày
-        for row, day_leave in enumerate(daily_leaves, 2):
+        for day_leave in daily_leaves:
+            row = writer.rows_written + 2
             try:
                 # 1. Ngày nghỉ
                 date_str = day_leave['date'].strftime('%d/%m/%Y')
-                cell_a = ws.cell(row=row, column=1, value=date_str)
-                cell_a.alignment = Alignment(horizontal="center", vertical="center")
 
                 # 2. Tên nhân viên
                 employee_name = str(day_leave['employee_name']).replace('\x00', '').replace('\r', '').replace('\n', ' ')
-                cell_b = ws.cell(row=row, column=2, value=employee_name)
-                # TẮT wrap_text để buộc excel hiển thị ngang, kiểm tra xem width có ăn không
-                cell_b.alignment = Alignment(vertical="center", wrap_text=False)
 
                 # 3. Mã nhân viên
                 employee_code = str(day_leave['employee_code']).replace('\x00', '').replace('\r', '').replace('\n', ' ')
-                cell_c = ws.cell(row=row, column=3, value=employee_code)
-                cell_c.alignment = Alignment(horizontal="center", vertical="center")
                 
                 # 4. Thời gian nghỉ (giờ bắt đầu - giờ kết thúc)
                 start_time_str = day_leave['start_time'].strftime('%H:%M')
                 end_time_str = day_leave['end_time'].strftime('%H:%M')
                 time_info = f"{start_time_str} - {end_time_str}"
-                cell_d = ws.cell(row=row, column=4, value=time_info)
-                cell_d.alignment = Alignment(horizontal="center", vertical="center")
                 
                 # 5. Loại nghỉ
                 leave_type = day_leave['leave_type']
@@ -20398,8 +19548,6 @@ def export_leave_history_excel():
                     leave_type_text += f" ({special_type})"
                 # Loại bỏ ký tự đặc biệt
                 leave_type_text = leave_type_text.replace('\x00', '').replace('\r', '').replace('\n', ' ')
-                cell_e = ws.cell(row=row, column=5, value=leave_type_text)
-                cell_e.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
                 
                 # 6. Số ngày hoặc Số giờ:phút
                 leave_type_code = leave_type.get('type', 'unknown')
@@ -20407,7 +19555,6 @@ def export_leave_history_excel():
                 # Với các loại nghỉ đặc biệt (đi trễ, về sớm, nghỉ 30 phút), hiển thị số giờ:phút
                 if leave_type_code in ['late_arrival', 'early_departure', '30min_break', 'late_early']:
                     # Tính số giờ:phút từ start_time và end_time
-                    from datetime import datetime, timedelta
                     start_dt = datetime.combine(day_leave['date'], day_leave['start_time'])
                     end_dt = datetime.combine(day_leave['date'], day_leave['end_time'])
                     duration = end_dt - start_dt
@@ -20421,76 +19568,39 @@ def export_leave_history_excel():
                     # Với các loại nghỉ thông thường, hiển thị số ngày
                     days_value = day_leave.get('fractional_days', leave_type.get('days', 1.0))
                 
-                cell_f = ws.cell(row=row, column=6, value=days_value)
-                cell_f.alignment = Alignment(horizontal="center", vertical="center")
+                writer.append(
+                    [date_str, employee_name, employee_code, time_info, leave_type_text, days_value],
+                    styles=row_styles
+                )
                 
             except Exception as e:
-                print(f"[ERROR] Error adding row {row}: {e}")
+                export_log.error("[ERROR] Error adding row %s: %s", row, e)
                 import traceback
                 traceback.print_exc()
                 # Thêm dữ liệu cơ bản nếu có lỗi
                 try:
-                    ws.cell(row=row, column=1, value="Lỗi dữ liệu")
                     employee_name = str(day_leave.get('employee_name', 'N/A')).replace('\x00', '').replace('\r', '').replace('\n', ' ')
-                    ws.cell(row=row, column=2, value=employee_name)
+                    first_cells = ["Lỗi dữ liệu", employee_name]
                 except Exception:
-                    ws.cell(row=row, column=1, value="Critical Error")
-                ws.cell(row=row, column=3, value="Lỗi hiển thị thời gian")
-                ws.cell(row=row, column=4, value="Lỗi hiển thị lý do")
-                ws.cell(row=row, column=5, value="Lỗi hiển thị loại nghỉ")
-                ws.cell(row=row, column=6, value="Lỗi")
-                ws.cell(row=row, column=7, value="Lỗi")
-        
-        # Điều chỉnh độ rộng cột - CẬP NHẬT MỚI (Đã chuyển xuống cuối)
-        ws.column_dimensions['A'].width = 15  # Ngày nghỉ
-        ws.column_dimensions['B'].width = 40  # Tên nhân viên (Giảm xuống 40)
-        ws.column_dimensions['C'].width = 17  # Mã nhân viên (Tăng 10%)
-        ws.column_dimensions['D'].width = 25  # Thời gian nghỉ
-        ws.column_dimensions['E'].width = 40  # Loại nghỉ
-        ws.column_dimensions['F'].width = 12  # Số ngày (Tăng thêm)
-        
-        # Điều chỉnh chiều cao hàng
-        for row in range(2, len(daily_leaves) + 2):
-            ws.row_dimensions[row].height = 30  # Chiều cao phù hợp cho dữ liệu đã tách
+                    first_cells = ["Critical Error", None]
+                writer.append(first_cells + [
+                    "Lỗi hiển thị thời gian",
+                    "Lỗi hiển thị lý do",
+                    "Lỗi hiển thị loại nghỉ",
+                    "Lỗi",
+                    "Lỗi",
+                ])
         
         # Thêm filter cho header
-        ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}{len(daily_leaves) + 1}"
-        
-        # Lưu file vào memory
-        from io import BytesIO
-        output = BytesIO()
-
-        try:
-            wb.save(output)
-            output.seek(0)
-        except Exception as save_error:
-            print(f"[ERROR] Error saving Excel file: {save_error}")
-            raise save_error
+        writer.set_auto_filter()
         
         # Tạo response
         # Tên file tiếng Việt + fallback ASCII theo RFC 5987
         vn_filename = f"Lịch_sử_nghỉ_phép_chi_tiết_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        from urllib.parse import quote
-        ascii_fallback = "lich_su_nghi_phep_chi_tiet.xlsx"
-        content_disposition = (
-            f"attachment; filename=\"{ascii_fallback}\"; "
-            f"filename*=UTF-8''{quote(vn_filename)}"
-        )
-        
-        # Tạo response với encoding đúng
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = content_disposition
-        response.headers['Content-Length'] = len(output.getvalue())
-        # Thêm header để tự động tải xuống Downloads
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        
-        return response
+        return writer.to_response(vn_filename, ascii_fallback="lich_su_nghi_phep_chi_tiet.xlsx")
         
     except Exception as e:
-        print(f"[ERROR] Error exporting Excel: {e}")
+        export_log.error("[ERROR] Error exporting Excel: %s", e)
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Lỗi khi xuất file Excel: {str(e)}'}), 500
@@ -20503,10 +19613,8 @@ def export_leave_history_excel():
 def export_attendance_excel_full():
     """Xuất nghỉ phép ra file Excel theo format chấm công FULL với đầy đủ thông tin ca, giờ làm, tăng ca"""
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-        from openpyxl.utils import get_column_letter
-        from utils.excel_leave_processor import process_leave_requests_for_excel
+        from utils.excel_stream_export import StreamingXlsxWriter, iter_query_in_chunks
+        from utils.leave_overlay import LeaveOverlayIndex
         from datetime import time as time_type
         
         # Helper function: Convert integer minutes to H:MM format (NO FLOATING POINT ERRORS)
@@ -20612,32 +19720,44 @@ def export_attendance_excel_full():
         if filter_to_date:
             query = query.filter(Attendance.date <= filter_to_date)
 
-        attendance_records = query.order_by(Attendance.date.desc()).all()
+        # Chấm công + đơn nghỉ đọc từ cùng 1 snapshot báo cáo (nếu bật) để 2 nguồn khớp nhau
+        report = report_session_for_request()
+
+        # Nạp toàn bộ đơn nghỉ đã duyệt của khoảng xuất trong 1 query (thay vì 1 query / dòng)
+        leave_overlay = LeaveOverlayIndex.for_window(
+            filter_from_date,
+            filter_to_date,
+            user_ids=None if current_role == 'ADMIN' else [user.id],
+            session=report.session
+        )
+
+        # Đọc theo từng lô (yield_per), không nạp ảnh chữ ký - file Full không dùng tới
+        attendance_records = iter_query_in_chunks(
+            query.with_session(report.session).options(
+                joinedload(Attendance.user),
+                *[defer(getattr(Attendance, column)) for column in Attendance.SIGNATURE_COLUMNS]
+            ).order_by(Attendance.date.desc(), Attendance.id.desc())
+        )
 
-        # Tạo workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Chấm công Full"
-        
         # HEADER - Match attendance history export format
         headers = [
             "Ngày", "Nhân viên", "Mã nhân viên", "Phòng ban",
             "Giờ vào", "Giờ ra", "Nghỉ", "Đối ứng",
             "Tổng giờ làm", "Giờ công", "Tăng ca trước 22h", "Tăng ca sau 22h", "Loại ngày"
         ]
-        
-        # Style header
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=11)
-        
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
+        # Column widths - Match attendance history format
+        # Ngày, Nhân viên, Mã nhân viên, Phòng ban, Giờ vào, Giờ ra, Nghỉ, Đối ứng,
+        # Tổng giờ làm, Giờ công, Tăng ca trước 22h, Tăng ca sau 22h, Loại ngày
+        column_widths = [12, 25, 15, 20, 10, 10, 10, 10, 12, 10, 15, 15, 15]
+        writer = StreamingXlsxWriter("Chấm công Full", headers, column_widths, header_style='export_header_blue')
+
+        # Cột B (Nhân viên) căn trái, các cột còn lại căn giữa; dòng có đơn đi trễ/về sớm tô cam
+        normal_styles = ['export_center', 'export_left'] + ['export_center'] * 11
+        highlight_styles = ['export_center_highlight', 'export_left_highlight'] + ['export_center_highlight'] * 11
 
         # Populate data
-        for row_idx, att in enumerate(attendance_records, 2):
+        for att in attendance_records:
+            row_idx = writer.rows_written + 2
             try:
                 # Lấy user info
                 att_user = att.user
@@ -20646,28 +19766,8 @@ def export_attendance_excel_full():
                 department = att_user.department if att_user else "N/A"
                 
                 # KIỂM TRA: Có đơn đi trễ/về sớm trong ngày này không?
-                # Using component-based date comparison because LeaveRequest stores dates in parts
-                y, m, d = att.date.year, att.date.month, att.date.day
-                
-                start_cond = db.or_(
-                    LeaveRequest.leave_from_year < y,
-                    db.and_(LeaveRequest.leave_from_year == y, LeaveRequest.leave_from_month < m),
-                    db.and_(LeaveRequest.leave_from_year == y, LeaveRequest.leave_from_month == m, LeaveRequest.leave_from_day <= d)
-                )
-                
-                end_cond = db.or_(
-                    LeaveRequest.leave_to_year > y,
-                    db.and_(LeaveRequest.leave_to_year == y, LeaveRequest.leave_to_month > m),
-                    db.and_(LeaveRequest.leave_to_year == y, LeaveRequest.leave_to_month == m, LeaveRequest.leave_to_day >= d)
-                )
-
-                leave_request = LeaveRequest.query.filter(
-                    LeaveRequest.user_id == att.user_id,
-                    start_cond,
-                    end_cond,
-                    # Removed request_type filter to include ALL leave types (late_early, leave, 30min_break, etc.)
-                    LeaveRequest.status == 'approved'
-                ).first()
+                # Tra cứu trong leave overlay (bao gồm TẤT CẢ loại đơn: late_early, leave, 30min_break, ...)
+                leave_request = leave_overlay.get(att.user_id, att.date)
                 
                 # Chuẩn bị giá trị - ĐỌC TỪ INTEGER MINUTES COLUMNS
                 actual_checkin = att.check_in
@@ -20691,12 +19791,11 @@ def export_attendance_excel_full():
                                  f.write(f"   Status: {leave_request.status}\n")
                                  f.write(f"   Period: {leave_request.leave_from_hour}:{leave_request.leave_from_minute} - {leave_request.leave_to_hour}:{leave_request.leave_to_minute}\n")
                     except Exception as e:
-                        print(f"Failed to write debug: {e}")
+                        export_log.debug("Failed to write debug: %s", e)
 
 
                 
                 # Màu cam cho row có leave request
-                orange_fill = PatternFill(start_color="FFA500", end_color="FFA500", fill_type="solid")
                 has_leave = False
                 
                 # NẾU CÓ ĐƠN ĐI TRỄ/VỀ SỚM (late_early) -> Highlight & Cập nhật giờ
@@ -20857,74 +19956,24 @@ def export_attendance_excel_full():
                         ot_after_str_val = minutes_to_hhmm(ot2_minutes)
 
 
-                # A: Ngày
-                cell = ws.cell(row=row_idx, column=1, value=att.date.strftime('%d/%m/%Y'))
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
-                
-                # B: Nhân viên
-                cell = ws.cell(row=row_idx, column=2, value=employee_name)
-                cell.alignment = Alignment(vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
-                
-                # C: Mã nhân viên
-                cell = ws.cell(row=row_idx, column=3, value=employee_code)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
-                
-                # D: Phòng ban
-                cell = ws.cell(row=row_idx, column=4, value=department)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
-                
-                # E: Giờ vào
+                # E/F: Giờ vào / Giờ ra
                 checkin_str = actual_checkin.strftime('%H:%M') if actual_checkin else "---"
-                cell = ws.cell(row=row_idx, column=5, value=checkin_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
-                
-                # F: Giờ ra
                 checkout_str = actual_checkout.strftime('%H:%M') if actual_checkout else "---"
-                cell = ws.cell(row=row_idx, column=6, value=checkout_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
                 
                 # G: Nghỉ - FORMAT FROM INTEGER MINUTES
                 break_str = minutes_to_hhmm(break_minutes)
-                cell = ws.cell(row=row_idx, column=7, value=break_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
                 
                 # H: Đối ứng (comp time total)
                 # Should use the actual comp time value from DB, not regular_hours!
                 comp_minutes = (att.comp_time_regular_minutes or 0) + (att.comp_time_overtime_minutes or 0)
                 comp_hours = comp_minutes / 60.0
                 comp_str = f"{int(comp_hours)}:{int((comp_hours % 1) * 60):02d}"
-                cell = ws.cell(row=row_idx, column=8, value=comp_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
                 
                 # I: Tổng giờ làm - FORMAT FROM INTEGER MINUTES
                 work_str = minutes_to_hhmm(work_minutes)
-                cell = ws.cell(row=row_idx, column=9, value=work_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
                 
                 # J: Giờ công (regular work hours) - FORMAT FROM INTEGER MINUTES
                 regular_str = minutes_to_hhmm(regular_minutes)
-                cell = ws.cell(row=row_idx, column=10, value=regular_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
                 
                 # K: Tăng ca trước 22h
                 # Use recalculated value if available, else DB
@@ -20933,76 +19982,51 @@ def export_attendance_excel_full():
                 else:
                      ot_before_str = att.overtime_before_22 if att.overtime_before_22 else "0:00"
                 
-                cell = ws.cell(row=row_idx, column=11, value=ot_before_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
-                
                 # L: Tăng ca sau 22h
                 # Use recalculated value if available, else DB
                 if 'ot_after_str_val' in locals() and is_late_early: # Fixed: use is_late_early flag
                      ot_after_str = ot_after_str_val
                 else:
                      ot_after_str = att.overtime_after_22 if att.overtime_after_22 else "0:00"
-
-                cell = ws.cell(row=row_idx, column=12, value=ot_after_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
                 
                 # M: Loại ngày (based on day_type field if available)
                 day_type_str = att.day_type if hasattr(att, 'day_type') and att.day_type else "Ngày thường"
-                cell = ws.cell(row=row_idx, column=13, value=day_type_str)
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-                if has_leave:
-                    cell.fill = orange_fill
+                
+                writer.append([
+                    att.date.strftime('%d/%m/%Y'),  # A: Ngày
+                    employee_name,                  # B: Nhân viên
+                    employee_code,                  # C: Mã nhân viên
+                    department,                     # D: Phòng ban
+                    checkin_str,
+                    checkout_str,
+                    break_str,
+                    comp_str,
+                    work_str,
+                    regular_str,
+                    ot_before_str,
+                    ot_after_str,
+                    day_type_str,
+                ], styles=highlight_styles if has_leave else normal_styles)
                 
             except Exception as e:
                 import traceback
-                print(f"[ERROR] Error processing row {row_idx} (Attendance ID: {att.id}): {e}")
+                export_log.error("[ERROR] Error processing row %s (Attendance ID: %s): %s", row_idx, att.id, e)
                 traceback.print_exc()
                 continue
         
-        # Set column widths - Match attendance history format
-        ws.column_dimensions['A'].width = 12  # Ngày
-        ws.column_dimensions['B'].width = 25  # Nhân viên  
-        ws.column_dimensions['C'].width = 15  # Mã nhân viên
-        ws.column_dimensions['D'].width = 20  # Phòng ban
-        ws.column_dimensions['E'].width = 10  # Giờ vào
-        ws.column_dimensions['F'].width = 10  # Giờ ra
-        ws.column_dimensions['G'].width = 10  # Nghỉ
-        ws.column_dimensions['H'].width = 10  # Đối ứng
-        ws.column_dimensions['I'].width = 12  # Tổng giờ làm
-        ws.column_dimensions['J'].width = 10  # Giờ công
-        ws.column_dimensions['K'].width = 15  # Tăng ca trước 22h
-        ws.column_dimensions['L'].width = 15  # Tăng ca sau 22h
-        ws.column_dimensions['M'].width = 15  # Loại ngày
-        
         # Auto-filter
-        ws.auto_filter.ref = f"A1:M{len(attendance_records) + 1}"
+        writer.set_auto_filter()
         
         # Sheet 2 removed as per user request - file now contains only attendance data
         
-        # Save to memory
-        from io import BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
-        
-        # Return file
-        from flask import make_response
-        from urllib.parse import quote
+        # Return file (stream từ file tạm)
         filename = f"cham_cong_full_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        response = make_response(output.read())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = f'attachment; filename*=UTF-8\'\'{quote(filename)}'
-
-        return response
+        return writer.to_response(filename, no_cache=False)
         
     except Exception as e:
         import traceback
-        print(f"[ERROR] Excel Full export failed: {e}")
-        print(traceback.format_exc())
+        export_log.error("[ERROR] Excel Full export failed: %s", e)
+        export_log.error("%s", traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
 
@@ -21029,7 +20053,8 @@ def export_leave_cases_excel():
     kết hợp nhiều loại nghỉ, có/không special_type, khoảng ngày nhiều ngày.
     """
     try:
-        from utils.excel_leave_processor import process_leave_requests_for_excel
+        from utils.excel_leave_processor import iter_leave_requests_for_excel
+        from utils.excel_stream_export import StreamingXlsxWriter
         from dataclasses import dataclass
         from datetime import datetime, timedelta
 
@@ -21115,65 +20140,31 @@ def export_leave_cases_excel():
         ]
 
         # Xử lý thành daily rows
-        daily_leaves = process_leave_requests_for_excel(cases)
-
-        # Xuất Excel (dùng cùng format với export chính)
-        wb = Workbook()
-        ws = wb.active
-        # Đặt tiêu đề sheet tiếng Việt (<=31 ký tự, không ký tự cấm)
-        ws.title = "Lịch sử nghỉ phép"
-
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
+        daily_leaves = iter_leave_requests_for_excel(cases)
 
+        # Xuất Excel (dùng cùng pipeline với export chính)
         headers = ["Nhân viên", "Ngày nghỉ", "Thời gian nghỉ", "Lý do", "Loại nghỉ", "Số ngày", "Ngày tạo"]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
+        column_widths = [30, 15, 18, 50, 30, 12, 20]
+        # Đặt tiêu đề sheet tiếng Việt (<=31 ký tự, không ký tự cấm)
+        writer = StreamingXlsxWriter("Lịch sử nghỉ phép", headers, column_widths,
+                                     header_style='export_header_navy', row_height=30)
 
-        for row, day_leave in enumerate(daily_leaves, 2):
+        for day_leave in daily_leaves:
             employee_info = f"{day_leave['employee_name']} ({day_leave['employee_code']})"
-            ws.cell(row=row, column=1, value=employee_info)
-            ws.cell(row=row, column=2, value=day_leave['date'].strftime('%d/%m/%Y'))
-            ws.cell(row=row, column=3, value=f"{day_leave['start_time'].strftime('%H:%M')} - {day_leave['end_time'].strftime('%H:%M')}")
-            ws.cell(row=row, column=4, value=str(day_leave['reason'] or ''))
             lt = day_leave['leave_type']
             lt_text = lt['name'] + (f" ({lt['special_type']})" if lt.get('special_type') else '')
-            ws.cell(row=row, column=5, value=lt_text)
-            ws.cell(row=row, column=6, value=day_leave.get('fractional_days', lt.get('days', 1.0)))
-            ws.cell(row=row, column=7, value=_vn_datetime_format(day_leave['created_at'], '%d/%m/%Y %H:%M'))
-
-        column_widths = [30, 15, 18, 50, 30, 12, 20]
-        for col, width in enumerate(column_widths, 1):
-            ws.column_dimensions[get_column_letter(col)].width = width
-
-        for row in range(2, len(daily_leaves) + 2):
-            ws.row_dimensions[row].height = 30
-
-        from io import BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+            writer.append([
+                employee_info,
+                day_leave['date'].strftime('%d/%m/%Y'),
+                f"{day_leave['start_time'].strftime('%H:%M')} - {day_leave['end_time'].strftime('%H:%M')}",
+                str(day_leave['reason'] or ''),
+                lt_text,
+                day_leave.get('fractional_days', lt.get('days', 1.0)),
+                _vn_datetime_format(day_leave['created_at'], '%d/%m/%Y %H:%M'),
+            ])
 
         vn_filename = f"Bộ_test_các_trường_hợp_nghỉ_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        from urllib.parse import quote
-        ascii_fallback = "bo_test_cac_truong_hop_nghi.xlsx"
-        content_disposition = (
-            f"attachment; filename=\"{ascii_fallback}\"; "
-            f"filename*=UTF-8''{quote(vn_filename)}"
-        )
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        response.headers['Content-Disposition'] = content_disposition
-        response.headers['Content-Length'] = len(output.getvalue())
-        # Thêm header để tự động tải xuống Downloads
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        return response
+        return writer.to_response(vn_filename, ascii_fallback="bo_test_cac_truong_hop_nghi.xlsx")
     except Exception as e:
         print(f"[ERROR] Error exporting test cases Excel: {e}")
         import traceback
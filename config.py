@@ -8,6 +8,8 @@ from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 load_dotenv()
 
+from utils.sqlite_tuning import sqlite_engine_options
+
 
 class Config:
     # SECRET_KEY phải được set trong .env cho production
@@ -32,6 +34,8 @@ class Config:
     SESSION_COOKIE_SAMESITE = 'Lax'
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
     SESSION_REFRESH_EACH_REQUEST = True
+    # Session phía server (cookie chỉ chứa session id): sqlite:///instance/sessions.db | redis://host:6379/0 | cookie://
+    SESSION_STORE_URL = os.environ.get('SESSION_STORE_URL', 'sqlite:///instance/sessions.db')
     
     # Security Headers
     SECURITY_HEADERS = {
@@ -43,18 +47,14 @@ class Config:
     
     # Rate Limiting
     RATELIMIT_ENABLED = True
-    RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
+    # memory:// (mỗi worker riêng) | redis://host:6379/0 | sqlite:///instance/rate_limits.db (chung trên 1 máy)
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL') or os.environ.get('REDIS_URL', 'memory://')
     
     # Database Configuration - SQLite Only
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///attendance.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_pre_ping': True,
-        'pool_recycle': 300,
-        'pool_size': 10,
-        'max_overflow': 20,
-        'pool_timeout': 30,
-    }
+    # SQLite: pool nhỏ + busy timeout; PRAGMA (WAL, synchronous...) đặt qua install_sqlite_pragmas trong app.py
+    SQLALCHEMY_ENGINE_OPTIONS = sqlite_engine_options(SQLALCHEMY_DATABASE_URI)
     
     # Logging Configuration
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -130,6 +130,7 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = sqlite_engine_options(SQLALCHEMY_DATABASE_URI)
     WTF_CSRF_ENABLED = False
 
     # SMTP Configuration for password reset - SECURE: No hardcoded credentials
@@ -4,9 +4,8 @@ Database models for the attendance management system
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta, time
-from sqlalchemy.orm import validates
-import logging
+from datetime import datetime
+from sqlalchemy.orm import validates, query_expression
 import re
 
 db = SQLAlchemy()
@@ -14,12 +13,18 @@ db = SQLAlchemy()
 # C3: Email validation regex
 EMAIL_REGEX = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
 
+def normalize_department(department):
+    """Khoá so sánh phòng ban: bỏ khoảng trắng đầu/cuối, chữ hoa.
+    Tính bằng Python vì UPPER() của SQLite chỉ đổi chữ ASCII (không đổi 'đ', 'ế'...)"""
+    return (department or '').strip().upper()
+
 class User(db.Model, UserMixin):
     """User model for employees, managers, and admins"""
     __tablename__ = 'users'
     __table_args__ = (
         db.Index('idx_user_department', 'department'),  # Index for department filtering
         db.Index('idx_user_is_deleted', 'is_deleted'),  # Index for soft delete queries
+        db.Index('idx_user_department_key', 'department_key', 'is_deleted'),  # Truy vấn theo nhóm (TEAM_LEADER)
     )
 
     id = db.Column(db.Integer, primary_key=True)
@@ -28,6 +33,7 @@ class User(db.Model, UserMixin):
     employee_id = db.Column(db.Integer, unique=True, nullable=False)
     roles = db.Column(db.String(100), nullable=False)
     department = db.Column(db.String(50), nullable=False)
+    department_key = db.Column(db.String(50), nullable=True)  # normalize_department(department), tự cập nhật khi gán department
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
@@ -88,6 +94,12 @@ class User(db.Model, UserMixin):
                 raise ValueError(f"Invalid email format: {email}")
         return email
 
+    @validates('department')
+    def validate_department(self, key, department):
+        """Giữ department_key đồng bộ khi tạo / sửa / upload nhân viên"""
+        self.department_key = normalize_department(department)
+        return department
+
     @validates('maternity_flex_from', 'maternity_flex_until')
     def validate_maternity_dates(self, key, value):
         """Validate maternity flex dates logic"""
@@ -106,6 +118,19 @@ class User(db.Model, UserMixin):
         """Get all soft deleted users"""
         return cls.query.filter_by(is_deleted=True).all()
 
+    @classmethod
+    def in_department(cls, department):
+        """Điều kiện user cùng phòng ban (không phân biệt hoa thường / khoảng trắng), dùng idx_user_department_key"""
+        return cls.department_key == normalize_department(department)
+
+    @classmethod
+    def team_ids(cls, department):
+        """Subquery id nhân viên chưa xoá cùng phòng ban - dùng cho mọi truy vấn theo nhóm:
+        Attendance.user_id.in_(User.team_ids(user.department))"""
+        return (db.select(cls.id)
+                .where(cls.in_department(department), cls.is_deleted == False)  # noqa: E712
+                .scalar_subquery())
+
     def __repr__(self):
         return f'<User {self.name} ({self.employee_id})>'
 
@@ -117,6 +142,8 @@ class Attendance(db.Model):
         db.Index('idx_attendance_user_date', 'user_id', 'date'),  # Composite index for user+date queries
         db.Index('idx_attendance_status', 'status'),  # Index for status filtering
         db.Index('idx_attendance_date', 'date'),  # Index for date range queries
+        db.Index('idx_attendance_created_at', 'created_at'),  # Freshness: bản ghi nộp gần đây
+        db.Index('idx_attendance_approved_at', 'approved_at'),  # Freshness: bản ghi duyệt gần đây
     )
 
     id = db.Column(db.Integer, primary_key=True)
@@ -180,6 +207,14 @@ class Attendance(db.Model):
     team_leader_signer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # ID người ký trưởng nhóm
     manager_signer_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # ID người ký quản lý
 
+    # Các cột chữ ký (base64, rất nặng) - bị defer trong chế độ danh sách
+    SIGNATURE_COLUMNS = ('signature', 'team_leader_signature', 'manager_signature')
+    # Cờ "có chữ ký" tính ngay trong SQL - chỉ có giá trị khi query dùng with_expression
+    # (xem utils/query_optimizer.signature_flag_options)
+    has_signature = query_expression()
+    has_team_leader_signature = query_expression()
+    has_manager_signature = query_expression()
+
     # Relationships
     user = db.relationship('User', foreign_keys=[user_id], backref=db.backref('attendances', lazy=True))
     approver = db.relationship('User', foreign_keys=[approved_by], backref=db.backref('approved_attendances', lazy=True))
@@ -197,583 +232,39 @@ class Attendance(db.Model):
                 raise ValueError("check_out must be after check_in")
         return check_out
 
-    def update_work_hours(self):
-        """Calculate and update work hours and overtime with precision handling"""
-        if not self.check_in or not self.check_out:
-            self.total_work_hours = None
-            self.overtime_before_22 = "0:00"
-            self.overtime_after_22 = "0:00"
-            self.regular_work_hours = None
-            return
-
-        def minutes_to_hhmm_precise(minutes):
-            """Convert minutes to HH:MM format with precision handling"""
-            if minutes < 0: minutes = 0
-            from utils.precision_utils import safe_minutes_to_hours, format_hours_minutes_precise
-            hours = safe_minutes_to_hours(minutes)
-            return format_hours_minutes_precise(hours)
-        
-        def minutes_to_hhmm(minutes):
-            """Convert integer minutes to H:MM string - PURE INTEGER, NO FLOAT ERRORS"""
-            if minutes is None or minutes < 0:
-                return "0:00"
-            hours = minutes // 60
-            mins = minutes % 60
-            return f"{hours}:{mins:02d}"
-
-        # Định nghĩa 5 ca chuẩn (bao gồm ca đặc biệt cho ngày nghỉ)
-        shift_map = {
-            '1': (time(7,30), time(16,30)),
-            '2': (time(9,0), time(18,0)),
-            '3': (time(11,0), time(20,0)),
-            '4': (time(8,0), time(17,0)),
-            '5': (time(0,0), time(23,59)),  # Ca đặc biệt: tự do giờ giấc cho ngày nghỉ
-        }
-        
-        # Nếu có mã ca, chỉ tự động gán giờ vào/ra ca chuẩn nếu chưa có giá trị
-        if self.shift_code in shift_map:
-            if not self.shift_start:
-                self.shift_start = shift_map[self.shift_code][0]
-            if not self.shift_end:
-                self.shift_end = shift_map[self.shift_code][1]
-
-        # 1. Tổng giờ làm: thời gian thực tế trừ giờ nghỉ
-        # Đảm bảo check_in và check_out là datetime, cùng ngày hoặc check_out > check_in
-        logger = logging.getLogger("attendance_logic")
-        logger.setLevel(logging.DEBUG)
-        if not logger.handlers:
-            handler = logging.FileHandler("attendance_debug.log", encoding='utf-8')
-            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
-            logger.addHandler(handler)
-
-        # Log giá trị đầu vào
-        logger.debug(f"check_in: {self.check_in} ({type(self.check_in)})")
-        logger.debug(f"check_out: {self.check_out} ({type(self.check_out)})")
-        logger.debug(f"break_time: {self.break_time}")
-
-        # Tính duration thực tế theo phút để tránh sai số float
-        duration_minutes = int(round((self.check_out - self.check_in).total_seconds() / 60))
-        logger.debug(f"duration_minutes (check_in to check_out): {duration_minutes}")
-        break_minutes = int(round((self.break_time or 0.0) * 60))
-        # Tổng phút làm = thời gian thực làm việc - phút nghỉ
-        total_work_minutes = max(0, duration_minutes - break_minutes)
-        logger.debug(f"total_work_minutes (after break deduction): {total_work_minutes}")
-        self.total_work_hours = round(total_work_minutes / 60.0, 2)
-        
-        # Trừ giờ đối ứng vào tổng giờ làm (cho phép chọn nhiều loại)
-        try:
-            total_comp_time_minutes = 0
-            
-            # Cuối tuần và Lễ Việt Nam: KHÔNG trừ đối ứng trong ca (comp_time_regular)
-            # Chỉ trừ đối ứng tăng ca chi tiết (trước/sau 22h). Legacy tổng tăng ca xử lý riêng bên dưới.
-            if self.holiday_type in ['weekend', 'vietnamese_holiday']:
-                # Use NEW minutes columns - NO FLOATING POINT ERRORS
-                total_comp_time_minutes += self.comp_time_ot_before_22_minutes or 0
-                total_comp_time_minutes += self.comp_time_ot_after_22_minutes or 0
-            else:
-                # Ngày thường và lễ Nhật: trừ tất cả loại đối ứng
-                # Use NEW minutes columns - NO FLOATING POINT ERRORS
-                total_comp_time_minutes += self.comp_time_regular_minutes or 0
-                total_comp_time_minutes += self.comp_time_overtime_minutes or 0
-                total_comp_time_minutes += self.comp_time_ot_before_22_minutes or 0
-                total_comp_time_minutes += self.comp_time_ot_after_22_minutes or 0
-            
-            if total_comp_time_minutes > 0:
-                total_after_comp_minutes = max(0, int(round(self.total_work_hours * 60)) - total_comp_time_minutes)
-                self.total_work_hours = round(total_after_comp_minutes / 60.0, 2)
-        except Exception:
-            # An toàn: nếu parse lỗi, giữ nguyên total_work_hours
-            pass
+    def shift_input(self):
+        """Các cột mà bộ tính giờ công đọc (utils/shift_engine.ShiftInput)"""
+        from utils.shift_engine import ShiftInput, DAY_OFF_TYPES, MATERNITY_SHIFT_CODES
 
-        # Với mẹ <12 tháng: không boost total_work_hours, chỉ tính giờ công = 8h và OT = phần vượt 8h (nếu có)
+        # Chỉ nạp user khi chính sách mẹ <12 tháng có thể áp dụng (ngày thường / lễ Nhật, ca 1-4)
+        is_maternity_flex = False
+        if self.shift_code in MATERNITY_SHIFT_CODES and self.holiday_type not in DAY_OFF_TYPES:
+            user = getattr(self, 'user', None)
+            is_maternity_flex = bool(user and getattr(user, 'is_maternity_flex', False))
+        return ShiftInput.from_record(self, is_maternity_flex=is_maternity_flex)
 
-        if self.shift_start and self.shift_end:
-            ca_start = datetime.combine(self.date, self.shift_start)
-            if self.shift_end > self.shift_start:
-                ca_end = datetime.combine(self.date, self.shift_end)
-            else:
-                ca_end = datetime.combine(self.date, self.shift_end) + timedelta(days=1)
-            
-            # Xử lý 22:00 - 22:00 luôn là của ngày check_in
-            twenty_two = datetime.combine(self.date, time(22, 0))
-
-            # 2. Giờ công thường: xử lý theo loại ngày
-            # FIX: Xử lý đúng trường hợp ca qua đêm khi check_out.date() != check_in.date()
-            if self.check_out.date() > self.check_in.date():
-                # CA QUA ĐÊM THỰC SỰ: check_out ở ngày khác check_in
-                # Tính thời gian làm việc = check_out - check_in (bao gồm cả phần qua đêm)
-                time_in_shift = round((self.check_out - self.check_in).total_seconds() / 3600, 2)
-            else:
-                # CA TRONG CÙNG NGÀY: logic cũ vẫn đúng
-                overlap_start = max(self.check_in, ca_start)
-                overlap_end = min(self.check_out, ca_end)
-                # Xử lý trường hợp ca qua đêm trong cùng ngày (edge case - hiếm xảy ra)
-                if overlap_end <= overlap_start and self.check_out.time() < self.check_in.time():
-                    # Trường hợp ca qua đêm: tính từ check_in đến ca_end
-                    time_in_shift = round(max(0, (ca_end - self.check_in).total_seconds() / 3600), 2)
-                else:
-                    time_in_shift = round(max(0, (overlap_end - overlap_start).total_seconds() / 3600), 2) if overlap_end > overlap_start else 0
-            
-            # Xử lý giờ công chính thức theo loại ngày
-            if self.holiday_type == 'vietnamese_holiday':
-                # Ngày lễ Việt Nam: được 8h giờ công thường (ngày nghỉ có lương)
-                self.regular_work_hours = 8.0
-                break_time_for_overtime = self.break_time
-            elif self.holiday_type == 'weekend':
-                # Cuối tuần: giờ công thường = 0, tất cả thời gian làm việc tính vào tăng ca
-                self.regular_work_hours = 0.0
-                break_time_for_overtime = self.break_time
-            elif self.holiday_type == 'japanese_holiday':
-                # Lễ Nhật: Giờ công = total_work_hours (đã trừ giờ nghỉ), trừ tất cả loại đối ứng
-                # Giới hạn tối đa 8h cho giờ công thường
-                regular_base = min(self.total_work_hours or 0.0, 8.0)
-                # Trừ tất cả loại đối ứng (giống ngày thường) - SỬ DỤNG CỘT MINUTES MỚI
-                total_comp_regular_minutes = (self.comp_time_regular_minutes or 0) + (self.comp_time_overtime_minutes or 0)
-                total_comp_regular = total_comp_regular_minutes / 60.0
-                regular_hours = round(max(0.0, regular_base - total_comp_regular), 2)
-                self.regular_work_hours = regular_hours
-                break_time_for_overtime = 0
-            else:
-                # Ngày thường: xử lý đặc biệt cho mẹ <12 tháng (ca 1-4)
-                is_maternity_flex = (
-                    getattr(self, 'user', None)
-                    and getattr(self.user, 'is_maternity_flex', False)
-                    and self.shift_code in ('1', '2', '3', '4')
-                )
-                if is_maternity_flex:
-                    # Mẹ <12 tháng: LUÔN được +1h bonus
-                    # Tính giờ làm thực tế trong ca (đã trừ break và đối ứng)
-                    comp_time_regular_hours = (self.comp_time_regular_minutes or 0) / 60.0
-                    effective_break = self.break_time + comp_time_regular_hours
-                    actual_hours_in_shift = round(max(0, time_in_shift - effective_break), 2)
-                    
-                    # Cộng 1h bonus vào giờ làm thực tế
-                    boosted_hours = actual_hours_in_shift + 1.0
-                    
-                    if boosted_hours <= 8.0:
-                        # Tổng <= 8h: giờ công = tổng
-                        self.regular_work_hours = boosted_hours
-                        self._maternity_overtime_bonus = 0.0
-                    else:
-                        # Tổng > 8h: giờ công = 8h, phần vượt -> tăng ca
-                        self.regular_work_hours = 8.0
-                        self._maternity_overtime_bonus = boosted_hours - 8.0
-                else:
-                    # Nhân viên thường: giờ nghỉ và đối ứng trong ca trừ vào giờ công thường, tối đa 8 giờ - SỬ DỤNG CỘT MINUTES MỚI
-                    comp_time_regular_hours = (self.comp_time_regular_minutes or 0) / 60.0
-                    effective_break_regular = self.break_time + comp_time_regular_hours
-                    regular_hours = round(max(0, time_in_shift - effective_break_regular), 2)
-                    if self.shift_code == '5':
-                        # Ca 5: KHÔNG có giờ công (regular). Tất cả thời gian là OT trước/sau 22h.
-                        self.regular_work_hours = 0.0
-                    else:
-                        self.regular_work_hours = min(regular_hours, 8.0)  # Giới hạn tối đa 8 giờ cho ngày thường
-                break_time_for_overtime = 0
+    def update_work_hours(self):
+        """Calculate and update work hours and overtime with precision handling"""
+        from utils.shift_engine import compute_work_hours
 
-            # 3. Tăng ca: tính thô hai phần trước/sau 22h
-            # Sau đó trừ "giờ nghỉ hiệu lực" theo từng phần:
-            # - phần trước 22h: trừ comp_time_ot_before_22
-            # - phần sau 22h: trừ comp_time_ot_after_22
-            
-            # Initialize OT variables as INTEGER MINUTES (NO FLOAT ERRORS)
-            ot_before_minutes = 0
-            ot_after_minutes = 0
-            
-            if self.holiday_type in ['vietnamese_holiday', 'weekend']:
-                # Ngày lễ và cuối tuần: tính thời gian từ check_in đến 22:00 - DÙNG INTEGER MINUTES
-                check_in_time = self.check_in.time()
-                check_out_time = self.check_out.time()
-                
-                # Tính tăng ca trước 22h - INTEGER MINUTES (NO FLOAT ERRORS)
-                if self.holiday_type == 'vietnamese_holiday':
-                    # Lễ Việt Nam: giới hạn đến 22:00
-                    if self.check_out <= twenty_two:
-                        # Toàn bộ thời gian làm việc trước 22h
-                        ot_before_minutes = int(round((self.check_out - self.check_in).total_seconds() / 60))
-                    else:
-                        # Tính thời gian từ check_in đến 22:00
-                        if self.check_in < twenty_two:
-                            # Có thời gian trước 22h
-                            ot_before_minutes = int(round((twenty_two - self.check_in).total_seconds() / 60))
-                        else:
-                            # Không có thời gian trước 22h
-                            ot_before_minutes = 0
-                else:
-                    # Cuối tuần: vẫn phân biệt tăng ca trước và sau 22h - INTEGER MINUTES
-                    # Tăng ca trước 22h: từ check_in đến min(22:00, check_out) (đã trừ giờ nghỉ)
-                    if self.check_in < twenty_two:
-                        # Giới hạn bởi thời gian làm việc thực tế
-                        actual_end = min(self.check_out, twenty_two)
-                        ot_before_minutes = int(round((actual_end - self.check_in).total_seconds() / 60))
-                        # Trừ giờ nghỉ ngay từ đầu cho cuối tuần - DÙNG INTEGER MINUTES
-                        break_mins = self.break_time_minutes if self.break_time_minutes else 60
-                        ot_before_minutes = max(0, ot_before_minutes - break_mins)
-                    else:
-                        ot_before_minutes = 0
-            elif self.holiday_type == 'japanese_holiday':
-                # Lễ Nhật: tăng ca = tổng giờ làm - giờ công - DÙNG INTEGER MINUTES
-                # Phân bổ ưu tiên phần sau 22h trước, phần còn lại cho trước 22h để phản ánh đúng mốc thời gian thực tế
-                work_minutes = self.total_work_minutes or 0
-                regular_minutes = self.regular_work_minutes or 0
-                overtime_total_minutes = max(0, work_minutes - regular_minutes)
-                
-                if overtime_total_minutes > 0:
-                    # Tính regular_end từ regular_minutes
-                    regular_mins_val = self.regular_work_minutes or 0
-                    regular_end = self.check_in + timedelta(minutes=regular_mins_val)
-                    
-                    # Dung lượng trước 22h (và trước giờ ra) - INTEGER MINUTES
-                    before_window_end = min(self.check_out, twenty_two)
-                    capacity_before_minutes = 0
-                    if before_window_end > regular_end:
-                        capacity_before_minutes = int(round((before_window_end - regular_end).total_seconds() / 60))
-                    
-                    # Dung lượng sau 22h (sau max(regular_end, 22:00) tới check_out) - INTEGER MINUTES
-                    after_window_start = max(regular_end, twenty_two)
-                    capacity_after_minutes = 0
-                    if self.check_out > after_window_start:
-                        capacity_after_minutes = int(round((self.check_out - after_window_start).total_seconds() / 60))
-                    
-                    # Phân bổ: sau 22h trước - INTEGER MINUTES
-                    ot_after_minutes = min(overtime_total_minutes, capacity_after_minutes)
-                    remaining_minutes = max(0, overtime_total_minutes - ot_after_minutes)
-                    ot_before_minutes = min(capacity_before_minutes, remaining_minutes)
-            else:
-                # Ngày thường: Tính OT trước 22h
-                # Xử lý đặc biệt cho mẹ <12 tháng (ca 1-4)
-                is_maternity_flex = (
-                    getattr(self, 'user', None)
-                    and getattr(self.user, 'is_maternity_flex', False)
-                    and self.shift_code in ('1', '2', '3', '4')
-                )
-                if is_maternity_flex:
-                    # Mẹ <12 tháng: logic tăng ca đơn giản hóa - INTEGER MINUTES
-                    # Tính phần làm sau ca (qua giờ hành chính) - từ giờ kết thúc ca đến check_out
-                    post_shift_ot_minutes = 0
-                    if self.check_out > ca_end:
-                        # Có làm qua giờ hành chính
-                        ot_end_22 = min(self.check_out, twenty_two)  # Giới hạn tới 22h
-                        if ot_end_22 > ca_end:
-                            post_shift_ot_minutes = int(round((ot_end_22 - ca_end).total_seconds() / 60))
-                    
-                    # Lấy bonus overflow từ phần giờ công (khi actual + 1h > 8h) - convert to minutes
-                    maternity_bonus_float = getattr(self, '_maternity_overtime_bonus', 0.0)
-                    maternity_bonus_minutes = int(round(maternity_bonus_float * 60))
-                    
-                    # Tăng ca trước 22h = tăng ca ngoài giờ + bonus overflow - INTEGER MINUTES
-                    ot_before_minutes = post_shift_ot_minutes + maternity_bonus_minutes
-                    
-                    # Tính tăng ca sau 22h riêng - INTEGER MINUTES
-                    ot_after_minutes = 0
-                    if self.check_out > twenty_two:
-                        ot_after_minutes = int(round((self.check_out - twenty_two).total_seconds() / 60))
-                elif self.shift_code == '5':
-                    # Ca 5 (tự do): KHÔNG có "giờ công", chỉ chia OT trước/sau 22h theo thời gian thực tế.
-                    # OT trước 22h: từ check_in đến min(check_out, 22:00 ngày vào)
-                    # OT sau 22h: từ max(check_in, 22:00 ngày vào) đến check_out (kể cả qua đêm)
-                    before_end = min(self.check_out, twenty_two)
-                    raw_before = int(round((before_end - self.check_in).total_seconds() / 60)) if before_end > self.check_in else 0
-
-                    after_start = max(self.check_in, twenty_two)
-                    raw_after = int(round((self.check_out - after_start).total_seconds() / 60)) if self.check_out > after_start else 0
-
-                    # Trừ giờ nghỉ vào OT (ưu tiên trừ phần trước 22h trước, còn dư trừ sang sau 22h)
-                    break_mins = self.break_time_minutes if self.break_time_minutes else int(round((self.break_time or 0.0) * 60))
-                    deduct = max(0, int(break_mins or 0))
-                    deduct_before = min(raw_before, deduct)
-                    raw_before -= deduct_before
-                    deduct -= deduct_before
-                    if deduct > 0:
-                        raw_after = max(0, raw_after - deduct)
-
-                    ot_before_minutes = raw_before
-                    ot_after_minutes = raw_after
-                else:
-                    # Ca 1-4: tính CẢ đi làm sớm VÀ về muộn - INTEGER MINUTES
-                    # 1) Đi làm sớm (trước giờ vào ca)
-                    pre_start = self.check_in
-                    pre_end = min(self.check_out, ca_start, twenty_two)
-                    pre_shift_ot_minutes = max(0, int(round((pre_end - pre_start).total_seconds() / 60))) if pre_end > pre_start and self.check_in < ca_start else 0
-                    logger.debug(f"Pre shift OT (early arrival): pre_start={pre_start}, pre_end={pre_end}, ca_start={ca_start}")
-                    logger.debug(f"Pre shift OT result: {pre_shift_ot_minutes} minutes")
-                    
-                    # 2) Về muộn (sau giờ ra ca nhưng trước 22h)
-                    post_start = max(self.check_in, ca_end)
-                    post_end = min(self.check_out, twenty_two)
-                    post_shift_ot_minutes = max(0, int(round((post_end - post_start).total_seconds() / 60))) if post_end > post_start and self.check_out > ca_end else 0
-                    logger.debug(f"Post shift OT (late departure): post_start={post_start}, post_end={post_end}, ca_end={ca_end}, check_out={self.check_out}")
-                    logger.debug(f"Post shift OT result: {post_shift_ot_minutes} minutes")
-                    
-                    ot_before_minutes = pre_shift_ot_minutes + post_shift_ot_minutes
-                    logger.debug(f"Total overtime before 22h: {ot_before_minutes} minutes (early: {pre_shift_ot_minutes}, late: {post_shift_ot_minutes})")
-            
-            # 4. Tăng ca sau 22h: thời gian từ 22:00 (ngày check_in) đến khi ra (kể cả qua đêm) - INTEGER MINUTES
-            if self.holiday_type in ['vietnamese_holiday', 'weekend']:
-                if self.holiday_type == 'vietnamese_holiday':
-                    # Lễ Việt Nam: hợp nhất xử lý, tính cả phần qua đêm - INTEGER MINUTES
-                    ot2_start = max(self.check_in, twenty_two)
-                    if self.check_out > ot2_start:
-                        ot_after_minutes = int(round((self.check_out - ot2_start).total_seconds() / 60))
-                    else:
-                        ot_after_minutes = 0
-                else:
-                    # Cuối tuần: tăng ca sau 22h từ 22:00 đến check_out - INTEGER MINUTES
-                    if self.check_out > twenty_two:
-                        ot_after_minutes = int(round((self.check_out - twenty_two).total_seconds() / 60))
-                    else:
-                        ot_after_minutes = 0
-            elif self.holiday_type == 'japanese_holiday':
-                # Japanese holiday: ot_after_minutes đã được tính ở trên (dòng 384)
-                # Không cần làm gì thêm
-                pass
-            else:
-                # Ngày thường: hợp nhất xử lý, tính cả phần qua đêm - INTEGER MINUTES
-                # Nếu là mẹ <12 tháng, OT sau 22h đã được tính trong phần trên
-                is_maternity_flex = (
-                    getattr(self, 'user', None)
-                    and getattr(self.user, 'is_maternity_flex', False)
-                    and self.shift_code in ('1', '2', '3', '4')
-                )
-                if not is_maternity_flex:
-                    # Nhân viên thường: tính OT sau 22h từ 22h đến check_out - INTEGER MINUTES
-                    ot2_start = max(self.check_in, twenty_two)
-                    if self.check_out > ot2_start:
-                        ot_after_minutes = int(round((self.check_out - ot2_start).total_seconds() / 60))
-                    else:
-                        ot_after_minutes = 0
-                # Nếu là mẹ <12 tháng, ot_after_minutes đã được tính trong phần trên, giữ nguyên
+        result = compute_work_hours(self.shift_input())
+        for field, value in result._asdict().items():
+            setattr(self, field, value)
 
+    def calculate_regular_work_hours(self):
+        """Calculate regular work hours (excluding overtime)"""
+        from utils.shift_engine import calculate_regular_hours
 
-            # 5. Trừ giờ đối ứng theo từng loại tăng ca - DÙNG INTEGER MINUTES (NO FLOAT ERRORS)
-            # Đối ứng tăng ca trước 22h
-            comp_minutes_before_22 = self.comp_time_ot_before_22_minutes or 0
-            if comp_minutes_before_22 > 0:
-                ot_before_minutes = max(0, ot_before_minutes - comp_minutes_before_22)
-            
-            # Đối ứng tăng ca sau 22h  
-            comp_minutes_after_22 = self.comp_time_ot_after_22_minutes or 0
-            if comp_minutes_after_22 > 0:
-                ot_after_minutes = max(0, ot_after_minutes - comp_minutes_after_22)
-            
-            # Legacy: trừ comp_time_overtime (tổng tăng ca) - DÙNG INTEGER MINUTES
-            comp_minutes_overtime = self.comp_time_overtime_minutes or 0
-            if comp_minutes_overtime > 0:
-                total_ot_minutes = ot_before_minutes + ot_after_minutes
-                deduction_minutes = min(comp_minutes_overtime, total_ot_minutes)
-                if deduction_minutes > 0:
-                    deduct_before = min(ot_before_minutes, deduction_minutes)
-                    ot_before_minutes -= deduct_before
-                    deduction_minutes -= deduct_before
-                    if deduction_minutes > 0:
-                        ot_after_minutes = max(0, ot_after_minutes - deduction_minutes)
-            
-            # Xử lý giờ nghỉ theo loại ngày - DÙNG INTEGER MINUTES
-            if self.holiday_type == 'vietnamese_holiday':
-                # Ngày lễ Việt Nam: giờ nghỉ trừ vào tăng ca trước 22h
-                if ot_before_minutes > 0:
-                    break_mins = self.break_time_minutes if self.break_time_minutes else 60
-                    ot_before_minutes = max(0, ot_before_minutes - break_mins)
-            # Cuối tuần: giờ nghỉ đã được trừ ngay từ đầu khi tính tăng ca trước 22h
-            # Ngày thường và lễ Nhật: giờ nghỉ đã được trừ vào giờ công thường rồi, không trừ vào OT
-
-            # Gán chuỗi H:MM - DÙNG INTEGER MINUTES (NO FLOAT ERRORS)
-            self.overtime_before_22 = minutes_to_hhmm(ot_before_minutes)
-            self.overtime_after_22 = minutes_to_hhmm(ot_after_minutes)
-        else:
-            # Nếu không có ca chuẩn, xử lý theo loại ngày
-            if self.holiday_type == 'vietnamese_holiday':
-                # Ngày lễ Việt Nam: được 8h giờ công thường (ngày nghỉ có lương)
-                self.regular_work_hours = 8.0
-                self.overtime_before_22 = "0:00"
-                self.overtime_after_22 = "0:00"
-            elif self.holiday_type == 'weekend':
-                # Cuối tuần: giờ công thường = 0 (ngày nghỉ không lương)
-                self.regular_work_hours = 0.0
-                # Tính tăng ca cho cuối tuần khi không có ca chuẩn
-                if self.check_in and self.check_out:
-                    # Tăng ca trước 22h: từ check_in đến 22:00 (trừ giờ nghỉ)
-                    check_in_time = self.check_in.time()
-                    check_out_time = self.check_out.time()
-                    twenty_two = time(22, 0)
-                    
-                    if check_in_time < twenty_two:
-                        overtime_before_22 = (twenty_two - check_in_time).total_seconds() / 3600
-                        # Trừ giờ nghỉ
-                        overtime_before_22 = max(0.0, overtime_before_22 - self.break_time)
-                    else:
-                        overtime_before_22 = 0.0
-                    
-                    # Tăng ca sau 22h: từ 22:00 đến check_out
-                    if check_out_time > twenty_two:
-                        overtime_after_22 = (check_out_time - twenty_two).total_seconds() / 3600
-                    else:
-                        overtime_after_22 = 0.0
-                    
-                    self.overtime_before_22 = minutes_to_hhmm_precise(overtime_before_22 * 60)
-                    self.overtime_after_22 = minutes_to_hhmm_precise(overtime_after_22 * 60)
-                else:
-                    self.overtime_before_22 = "0:00"
-                    self.overtime_after_22 = "0:00"
-            elif self.holiday_type == 'japanese_holiday':
-                # Lễ Nhật: xử lý đặc biệt theo thời gian làm việc (khi không có ca chuẩn)
-                total_work_duration = (self.check_out - self.check_in).total_seconds() / 3600 if self.check_in and self.check_out else 0.0
-                
-                # Lễ Nhật: Giờ công = total_work_hours (đã trừ giờ nghỉ), trừ tất cả loại đối ứng
-                # Giới hạn tối đa 8h cho giờ công thường
-                regular_base = min(self.total_work_hours or 0.0, 8.0)
-                # Trừ tất cả loại đối ứng (giống ngày thường) - SỬ DỤNG CỘT MINUTES MỚI
-                total_comp_regular_minutes = (self.comp_time_regular_minutes or 0) + (self.comp_time_overtime_minutes or 0)
-                total_comp_regular = total_comp_regular_minutes / 60.0
-                self.regular_work_hours = round(max(0.0, regular_base - total_comp_regular), 2)
-                # Tính tăng ca cho lễ Nhật khi không có ca chuẩn (giống ngày thường)
-                if self.check_in and self.check_out:
-                    # Lễ Nhật: tính tăng ca giống ngày thường - trừ giờ công thường trước
-                    # Tăng ca trước 22h: từ (check_in + giờ công thường) đến 22:00
-                    check_in_time = self.check_in.time()
-                    check_out_time = self.check_out.time()
-                    twenty_two = time(22, 0)
-                    
-                    # Tính thời điểm bắt đầu tăng ca (sau khi đã làm đủ giờ công thường + giờ nghỉ)
-                    regular_start = datetime.combine(self.date, check_in_time)
-                    overtime_start = regular_start + timedelta(hours=self.regular_work_hours + self.break_time)
-                    
-                    # Xử lý trường hợp ca qua đêm
-                    if self.check_out < self.check_in:
-                        # Ca qua đêm: check_out thuộc ngày hôm sau
-                        overtime_start_date = overtime_start.date()
-                        twenty_two_datetime = datetime.combine(overtime_start_date, twenty_two)
-                        
-                        if overtime_start < twenty_two_datetime:
-                            # Có thời gian tăng ca trước 22h
-                            overtime_before_22 = (twenty_two_datetime - overtime_start).total_seconds() / 3600
-                        else:
-                            overtime_before_22 = 0.0
-                    else:
-                        # Ca trong cùng ngày
-                        if overtime_start.time() < twenty_two:
-                            # Có thời gian tăng ca trước 22h
-                            overtime_before_22 = (twenty_two - overtime_start.time()).total_seconds() / 3600
-                        else:
-                            overtime_before_22 = 0.0
-                    
-                    # Tăng ca sau 22h: từ 22:00 đến check_out
-                    if self.check_out < self.check_in:
-                        # Ca qua đêm: check_out thuộc ngày hôm sau
-                        check_out_date = self.check_out.date()
-                        twenty_two_datetime = datetime.combine(check_out_date, twenty_two)
-                        if self.check_out > twenty_two_datetime:
-                            overtime_after_22 = (self.check_out - twenty_two_datetime).total_seconds() / 3600
-                        else:
-                            overtime_after_22 = 0.0
-                    else:
-                        # Ca trong cùng ngày
-                        if check_out_time > twenty_two:
-                            overtime_after_22 = (check_out_time - twenty_two).total_seconds() / 3600
-                        else:
-                            overtime_after_22 = 0.0
-                    
-                    self.overtime_before_22 = minutes_to_hhmm_precise(overtime_before_22 * 60)
-                    self.overtime_after_22 = minutes_to_hhmm_precise(overtime_after_22 * 60)
+        return calculate_regular_hours(self.shift_input())
 
-        # 4. Phần dư so với required_hours đã được xử lý trong phần tính OT cho mẹ <12 tháng ở trên
+    def to_dict(self, include_signatures=True):
+        """Convert attendance record to dictionary
 
-    def calculate_regular_work_hours(self):
-        """Calculate regular work hours (excluding overtime)"""
-        if not self.check_in or not self.check_out:
-            return 0.0
-
-        # Ca 5 (tự do): không có giờ công thường (regular). Toàn bộ là OT trước/sau 22h.
-        # Ngoại lệ: Lễ Việt Nam vẫn được 8h giờ công mặc định (xử lý bên dưới theo holiday_type).
-        if self.shift_code == '5' and self.holiday_type != 'vietnamese_holiday':
-            return 0.0
-
-        # Helper: áp dụng trần giờ công theo required_hours nếu có (cho ngày thường / lễ Nhật)
-        def _cap_by_required(base_hours: float) -> float:
-            req = self.required_hours
-            # Chỉ áp dụng nếu có required_hours và nhỏ hơn base
-            if req is not None and req > 0 and req < base_hours:
-                return req
-            return base_hours
-
-        if self.holiday_type == 'vietnamese_holiday':
-            return 8.0  # Ngày lễ Việt Nam: được 8h giờ công thường (ngày nghỉ có lương)
-        if self.holiday_type == 'weekend':
-            return 0.0  # Cuối tuần: giờ công thường = 0 (ngày nghỉ không lương)
-        if self.holiday_type == 'japanese_holiday':
-            # Lễ Nhật: Giờ công = total_work_hours (đã trừ giờ nghỉ), trừ tất cả loại đối ứng
-            # Giới hạn tối đa 8h cho giờ công thường, sau đó trần theo required_hours (nếu có)
-            if self.total_work_hours is not None:
-                base = min(self.total_work_hours, 8.0)
-            else:
-                # Fallback: tính theo thời gian thực tế trừ giờ nghỉ
-                duration_hours = (self.check_out - self.check_in).total_seconds() / 3600
-                base = min(max(0.0, duration_hours - self.break_time), 8.0)
-            base = _cap_by_required(base)
-            # Trừ tất cả loại đối ứng (giống ngày thường) - SỬ DỤNG CỘT MINUTES MỚI
-            total_comp_regular_minutes = (self.comp_time_regular_minutes or 0) + (self.comp_time_overtime_minutes or 0)
-            total_comp_regular = total_comp_regular_minutes / 60.0
-            return round(max(0.0, base - total_comp_regular), 2)
-
-        # Ngày thường: tính giờ công và giới hạn tối đa 8 giờ, sau đó trần theo required_hours (nếu có)
-        # Xử lý đặc biệt cho mẹ <12 tháng (ca 1-4)
-        is_maternity_flex = (
-            getattr(self, 'user', None)
-            and getattr(self.user, 'is_maternity_flex', False)
-            and self.shift_code in ('1', '2', '3', '4')
-        )
-        if is_maternity_flex:
-            # Mẹ <12 tháng: LUÔN được +1h bonus
-            if self.shift_start and self.shift_end:
-                ca_start = datetime.combine(self.date, self.shift_start)
-                if self.shift_end > self.shift_start:
-                    ca_end = datetime.combine(self.date, self.shift_end)
-                else:
-                    ca_end = datetime.combine(self.date, self.shift_end) + timedelta(days=1)
-                overlap_start = max(self.check_in, ca_start)
-                overlap_end = min(self.check_out, ca_end)
-                time_in_shift = round(max(0, (overlap_end - overlap_start).total_seconds() / 3600), 2) if overlap_end > overlap_start else 0
-            else:
-                time_in_shift = (self.check_out - self.check_in).total_seconds() / 3600
-            
-            comp_time_regular_hours = (self.comp_time_regular_minutes or 0) / 60.0
-            effective_break = self.break_time + comp_time_regular_hours
-            actual_hours = round(max(0, time_in_shift - effective_break), 2)
-            
-            # Cộng 1h bonus, giới hạn tối đa 8h
-            boosted = actual_hours + 1.0
-            return min(boosted, 8.0)
-        
-        if self.shift_start and self.shift_end:
-            ca_start = datetime.combine(self.date, self.shift_start)
-            if self.shift_end > self.shift_start:
-                ca_end = datetime.combine(self.date, self.shift_end)
-            else:
-                ca_end = datetime.combine(self.date, self.shift_end) + timedelta(days=1)
-            # Lấy phần giao nhau giữa [check_in, check_out] và [shift_start, shift_end]
-            overlap_start = max(self.check_in, ca_start)
-            overlap_end = min(self.check_out, ca_end)
-            time_in_shift = round(max(0, (overlap_end - overlap_start).total_seconds() / 3600), 2) if overlap_end > overlap_start else 0
-            # Giờ công chính thức = thời gian trong ca - giờ nghỉ - đối ứng trong ca, tối đa 8 giờ - SỬ DỤNG CỘT MINUTES MỚI
-            comp_time_regular_hours = (self.comp_time_regular_minutes or 0) / 60.0
-            effective_break_regular = self.break_time + comp_time_regular_hours
-            regular_hours = round(max(0, time_in_shift - effective_break_regular), 2)
-            regular_hours = min(regular_hours, 8.0)
-            regular_hours = _cap_by_required(regular_hours)
-            return regular_hours
-        else:
-            # Nếu không có ca chuẩn, tính theo cách cũ - SỬ DỤNG CỘT MINUTES MỚI
-            comp_time_regular_hours = (self.comp_time_regular_minutes or 0) / 60.0
-            effective_break_regular = self.break_time + comp_time_regular_hours
-            actual_work_duration_hours = (self.check_out - self.check_in).total_seconds() / 3600 - effective_break_regular
-            regular_hours = round(max(0, actual_work_duration_hours), 2)
-            regular_hours = min(regular_hours, 8.0)
-            regular_hours = _cap_by_required(regular_hours)
-            return regular_hours  # Giới hạn tối đa 8 giờ và theo required_hours cho ngày thường / lễ Nhật
-
-    def to_dict(self):
-        """Convert attendance record to dictionary"""
+        include_signatures=False: chế độ danh sách - không trả ảnh chữ ký base64,
+        chỉ trả các cờ has_signature / has_team_leader_signature / has_manager_signature.
+        """
         work_hours_val = self.calculate_regular_work_hours()
-        return {
+        data = {
             'id': self.id,
             'date': self.date.strftime('%d/%m/%Y'),
             'check_in': self.check_in.strftime('%H:%M') if self.check_in else None,
@@ -799,10 +290,28 @@ class Attendance(db.Model):
             'shift_code': self.shift_code,
             'shift_start': self.shift_start.strftime('%H:%M') if self.shift_start else None,
             'shift_end': self.shift_end.strftime('%H:%M') if self.shift_end else None,
-            'signature': self.signature,
-            'team_leader_signature': self.team_leader_signature,
-            'manager_signature': self.manager_signature
         }
+        if include_signatures:
+            data.update({
+                'signature': self.signature,
+                'team_leader_signature': self.team_leader_signature,
+                'manager_signature': self.manager_signature
+            })
+        else:
+            data.update(self.signature_flags())
+        return data
+
+    def signature_flags(self):
+        """Cờ có/không có chữ ký; ưu tiên giá trị đã tính sẵn trong SQL để không nạp blob"""
+        flags = {}
+        for column in self.SIGNATURE_COLUMNS:
+            flag_name = f"has_{column}"
+            flag = getattr(self, flag_name)
+            if flag is None:
+                value = getattr(self, column)  # Fallback: query không nạp cờ -> đọc cột
+                flag = bool(value and value.strip())
+            flags[flag_name] = bool(flag)
+        return flags
 
     @staticmethod
     def _format_hours_minutes(hours):
@@ -1212,4 +721,68 @@ class Activation(db.Model):
 
     def __repr__(self):
         status = "activated" if self.is_activated else "inactive"
-        return f'<Activation {status}>'
\ No newline at end of file
+        return f'<Activation {status}>'
+
+class SheetSyncTask(db.Model):
+    """
+    Outbox cập nhật Google Sheet (utils/sheet_sync_outbox.py).
+    Mỗi dòng là 1 lần ghi 1 ngày chấm công / ngày nghỉ lên timesheet; nằm trong DB nên
+    không mất khi restart, worker đọc lại các dòng pending và làm tiếp.
+    """
+    __tablename__ = 'sheet_sync_outbox'
+    __table_args__ = (
+        db.Index('idx_sheet_sync_outbox_due', 'state', 'next_retry_at'),  # Worker lấy việc đến hạn
+        db.Index('idx_sheet_sync_outbox_task_key', 'task_key'),  # Gộp các lần ghi cùng ô
+        db.Index('idx_sheet_sync_outbox_leave', 'leave_request_id'),  # Trạng thái đồng bộ theo đơn nghỉ
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_key = db.Column(db.String(100), nullable=False)  # vd: "leave-12-3", "break30-12", "1534"
+    leave_request_id = db.Column(db.Integer, nullable=True)
+    employee_team = db.Column(db.String(100), nullable=True)
+    employee_id = db.Column(db.String(50), nullable=True)
+    sheet_date = db.Column(db.String(10), nullable=True)  # YYYY-MM-DD
+    spreadsheet_key = db.Column(db.String(120), nullable=True)  # "team|YYYYMM" -> 1 file timesheet
+    payload = db.Column(db.JSON, nullable=False)  # attendance_data truyền cho batch update
+    state = db.Column(db.String(20), nullable=False, default='pending')  # pending / processing / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_retry_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    done_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<SheetSyncTask {self.task_key} ({self.state})>'
+
+
+class EmailOutboxMessage(db.Model):
+    """
+    Outbox email (utils/email_outbox.py): email thông báo đơn nghỉ, đặt lại mật khẩu...
+    Mỗi dòng là 1 email đã dựng sẵn (MIME); worker gửi qua 1 kết nối SMTP dùng lại,
+    lỗi tạm thời -> thử lại với backoff, restart không mất email đang chờ.
+    """
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        db.Index('idx_email_outbox_due', 'state', 'next_retry_at'),  # Worker lấy email đến hạn
+        db.Index('idx_email_outbox_request', 'request_id'),  # Trạng thái email theo đơn nghỉ
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # leave_request / password_reset
+    request_id = db.Column(db.Integer, nullable=True)  # LeaveRequest.id (trạng thái email trên UI)
+    user_id = db.Column(db.Integer, nullable=True)  # Người nhận trạng thái qua SSE
+    sender = db.Column(db.String(255), nullable=False)  # Envelope MAIL FROM
+    recipients = db.Column(db.JSON, nullable=False)  # Envelope RCPT TO
+    subject = db.Column(db.String(500), nullable=True)
+    message = db.Column(db.Text, nullable=False)  # msg.as_string()
+    state = db.Column(db.String(20), nullable=False, default='pending')  # pending / sending / sent / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_retry_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<EmailOutboxMessage {self.kind} #{self.id} ({self.state})>'
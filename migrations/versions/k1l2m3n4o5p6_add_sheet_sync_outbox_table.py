@@ -0,0 +1,54 @@
+"""Add sheet_sync_outbox table (durable Google Sheets sync queue)
+
+Revision ID: k1l2m3n4o5p6
+Revises: j1k2l3m4n5o6
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'k1l2m3n4o5p6'
+down_revision = 'j1k2l3m4n5o6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Outbox cho cập nhật Google Sheet: giữ lại việc chưa ghi khi restart / lỗi"""
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'sheet_sync_outbox' not in inspector.get_table_names():
+        op.create_table('sheet_sync_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_key', sa.String(length=100), nullable=False),
+        sa.Column('leave_request_id', sa.Integer(), nullable=True),
+        sa.Column('employee_team', sa.String(length=100), nullable=True),
+        sa.Column('employee_id', sa.String(length=50), nullable=True),
+        sa.Column('sheet_date', sa.String(length=10), nullable=True),
+        sa.Column('spreadsheet_key', sa.String(length=120), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('state', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_retry_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('done_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_sheet_sync_outbox_due', 'sheet_sync_outbox', ['state', 'next_retry_at'])
+        op.create_index('idx_sheet_sync_outbox_task_key', 'sheet_sync_outbox', ['task_key'])
+        op.create_index('idx_sheet_sync_outbox_leave', 'sheet_sync_outbox', ['leave_request_id'])
+
+
+def downgrade():
+    """Remove sheet_sync_outbox table"""
+    op.drop_index('idx_sheet_sync_outbox_leave', table_name='sheet_sync_outbox')
+    op.drop_index('idx_sheet_sync_outbox_task_key', table_name='sheet_sync_outbox')
+    op.drop_index('idx_sheet_sync_outbox_due', table_name='sheet_sync_outbox')
+    op.drop_table('sheet_sync_outbox')
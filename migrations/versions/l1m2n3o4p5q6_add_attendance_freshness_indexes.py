@@ -0,0 +1,34 @@
+"""Add indexes on attendances.created_at / approved_at (pending counters freshness)
+
+Revision ID: l1m2n3o4p5q6
+Revises: k1l2m3n4o5p6
+Create Date: 2026-10-17 23:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'l1m2n3o4p5q6'
+down_revision = 'k1l2m3n4o5p6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Index cho truy vấn bản ghi nộp / duyệt gần đây khi đối soát pending_counters"""
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    existing = {index['name'] for index in inspector.get_indexes('attendances')}
+    if 'idx_attendance_created_at' not in existing:
+        op.create_index('idx_attendance_created_at', 'attendances', ['created_at'])
+    if 'idx_attendance_approved_at' not in existing:
+        op.create_index('idx_attendance_approved_at', 'attendances', ['approved_at'])
+
+
+def downgrade():
+    """Remove attendance freshness indexes"""
+    op.drop_index('idx_attendance_approved_at', table_name='attendances')
+    op.drop_index('idx_attendance_created_at', table_name='attendances')
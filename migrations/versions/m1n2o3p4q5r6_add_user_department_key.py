@@ -0,0 +1,48 @@
+"""Add users.department_key (normalized department) + index for team-scoped queries
+
+Revision ID: m1n2o3p4q5r6
+Revises: l1m2n3o4p5q6
+Create Date: 2026-10-17 23:55:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'm1n2o3p4q5r6'
+down_revision = 'l1m2n3o4p5q6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Thêm department_key, điền giá trị cho user hiện có và tạo index (department_key, is_deleted)"""
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    columns = {column['name'] for column in inspector.get_columns('users')}
+    if 'department_key' not in columns:
+        with op.batch_alter_table('users', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('department_key', sa.String(length=50), nullable=True))
+
+    # Chuẩn hoá bằng Python (giống database.models.normalize_department):
+    # UPPER() của SQLite không đổi chữ có dấu tiếng Việt
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('department', sa.String),
+                     sa.column('department_key', sa.String))
+    rows = conn.execute(sa.select(users.c.id, users.c.department)).fetchall()
+    for user_id, department in rows:
+        conn.execute(users.update().where(users.c.id == user_id)
+                     .values(department_key=(department or '').strip().upper()))
+
+    existing = {index['name'] for index in inspector.get_indexes('users')}
+    if 'idx_user_department_key' not in existing:
+        op.create_index('idx_user_department_key', 'users', ['department_key', 'is_deleted'])
+
+
+def downgrade():
+    """Remove department_key column and index"""
+    op.drop_index('idx_user_department_key', table_name='users')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('department_key')
@@ -0,0 +1,52 @@
+"""Add email_outbox table (durable SMTP send queue)
+
+Revision ID: n1o2p3q4r5s6
+Revises: m1n2o3p4q5r6
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'n1o2p3q4r5s6'
+down_revision = 'm1n2o3p4q5r6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Outbox email: worker gửi qua 1 kết nối SMTP dùng lại, thử lại khi lỗi, không mất khi restart"""
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'email_outbox' not in inspector.get_table_names():
+        op.create_table('email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=30), nullable=False),
+        sa.Column('request_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('sender', sa.String(length=255), nullable=False),
+        sa.Column('recipients', sa.JSON(), nullable=False),
+        sa.Column('subject', sa.String(length=500), nullable=True),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('state', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_retry_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('idx_email_outbox_due', 'email_outbox', ['state', 'next_retry_at'])
+        op.create_index('idx_email_outbox_request', 'email_outbox', ['request_id'])
+
+
+def downgrade():
+    """Remove email_outbox table"""
+    op.drop_index('idx_email_outbox_request', table_name='email_outbox')
+    op.drop_index('idx_email_outbox_due', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,129 @@
+"""
+Benchmark: bộ nhớ và thời gian xuất Excel lịch sử chấm công.
+
+So sánh trên dữ liệu tổng hợp:
+    - legacy   : .all() + Workbook() thường, style từng ô
+    - streaming: yield_per + Workbook(write_only=True) + NamedStyle (utils.excel_stream_export)
+
+Bộ nhớ đo bằng tracemalloc (đỉnh cấp phát Python trong lúc xuất).
+
+Chạy:
+    python scripts/bench_excel_export.py [--rows 20000 50000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, time as time_type, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from openpyxl import Workbook  # noqa: E402
+from openpyxl.styles import Alignment, Border, Side  # noqa: E402
+from sqlalchemy.orm import joinedload  # noqa: E402
+
+from database.models import db, User, Attendance  # noqa: E402
+from utils.excel_stream_export import StreamingXlsxWriter, iter_query_in_chunks  # noqa: E402
+from utils.query_optimizer import signature_flag_options  # noqa: E402
+
+HEADERS = ["Ngày", "Nhân viên", "Mã nhân viên", "Phòng ban", "Giờ vào", "Giờ ra", "Tổng giờ làm"]
+
+
+def create_app(db_path: str) -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(n_rows: int) -> None:
+    users = [User(name=f"Nhân viên {i}", employee_id=300000 + i, roles='EMPLOYEE', department=f"DEPT{i % 10}",
+                  password_hash='x') for i in range(max(1, n_rows // 250))]
+    db.session.add_all(users)
+    db.session.flush()
+    start = date(2024, 1, 1)
+    for i in range(n_rows):
+        d = start + timedelta(days=i // len(users))
+        db.session.add(Attendance(
+            user_id=users[i % len(users)].id, date=d, status='approved', approved=True,
+            check_in=datetime.combine(d, time_type(8, 0)), check_out=datetime.combine(d, time_type(17, 0)),
+            total_work_minutes=480, regular_work_minutes=480,
+        ))
+    db.session.commit()
+
+
+def _row(att):
+    u = att.user
+    return [att.date, u.name, str(u.employee_id), u.department,
+            att.check_in.strftime('%H:%M'), att.check_out.strftime('%H:%M'), att.total_work_minutes]
+
+
+def _query():
+    return Attendance.query.options(joinedload(Attendance.user)).order_by(Attendance.date.desc(), Attendance.id.desc())
+
+
+def export_legacy(path: str) -> None:
+    border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    wb = Workbook()
+    ws = wb.active
+    for col, header in enumerate(HEADERS, 1):
+        ws.cell(row=1, column=col, value=header)
+    for row_idx, att in enumerate(_query().all(), 2):
+        for col, val in enumerate(_row(att), 1):
+            cell = ws.cell(row=row_idx, column=col, value=val)
+            cell.border = border
+            cell.alignment = Alignment(horizontal='center', vertical='center')
+    wb.save(path)
+
+
+def export_streaming(path: str) -> None:
+    writer = StreamingXlsxWriter("Bench", HEADERS, [12, 25, 15, 20, 10, 10, 12])
+    for att in iter_query_in_chunks(_query().options(*signature_flag_options())):
+        writer.append(_row(att), styles='export_grid_text')
+    writer.set_auto_filter()
+    writer.save(path)
+
+
+def measure(func, path: str) -> tuple[float, float]:
+    db.session.expunge_all()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    func(path)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(path)
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000, 50000])
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench_excel.db'))
+    args = parser.parse_args()
+
+    out_path = os.path.join(ROOT, 'bench_excel_export.xlsx')
+    for n_rows in args.rows:
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        app = create_app(args.db)
+        with app.app_context():
+            db.create_all()
+            seed(n_rows)
+            print(f"Dữ liệu: {n_rows} dòng chấm công")
+            for name, func in (('legacy', export_legacy), ('streaming', export_streaming)):
+                elapsed, peak_mb = measure(func, out_path)
+                print(f"  {name:9s}: {elapsed:7.2f}s | peak {peak_mb:8.1f} MB")
+            db.session.remove()
+        os.remove(args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: kích thước payload và độ trễ của /api/attendance/history trước/sau khi bỏ chữ ký.
+
+So sánh trên dữ liệu tổng hợp (mỗi bản ghi có 3 chữ ký base64 ~ --sig-kb KB):
+    - full : optimize_attendance_history_query(...) + to_dict()                       (có ảnh chữ ký)
+    - list : optimize_attendance_history_query(..., include_signatures=False)
+             + to_dict(include_signatures=False)                                       (chỉ cờ has_*)
+
+Chạy:
+    python scripts/bench_history_payload.py [--rows 1000] [--sig-kb 30] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, time as time_type, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+
+from database.models import db, User, Attendance  # noqa: E402
+from utils.query_optimizer import optimize_attendance_history_query  # noqa: E402
+
+
+def create_app(db_path: str) -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def fake_signature(size_kb: int, seed: int) -> str:
+    raw = (bytes([seed % 256]) + os.urandom(15)) * (size_kb * 1024 // 16 * 3 // 4)
+    return "data:image/png;base64," + base64.b64encode(raw).decode('ascii')
+
+
+def seed(n_rows: int, sig_kb: int) -> tuple[int, date, date]:
+    users = [User(name=f"NV {i}", employee_id=200000 + i, roles='EMPLOYEE', department='BUD', password_hash='x')
+             for i in range(max(1, n_rows // 250) + 1)]
+    db.session.add_all(users)
+    db.session.flush()
+    approver = users[0]
+
+    start = date(2025, 1, 1)
+    sig = fake_signature(sig_kb, 1)
+    for i in range(n_rows):
+        u = users[1 + i % (len(users) - 1)] if len(users) > 1 else users[0]
+        d = start + timedelta(days=i // max(1, len(users) - 1))
+        db.session.add(Attendance(
+            user_id=u.id, date=d, status='approved', approved=True, approved_by=approver.id,
+            check_in=datetime.combine(d, time_type(8, 0)), check_out=datetime.combine(d, time_type(17, 0)),
+            total_work_hours=8.0, signature=sig, team_leader_signature=sig, manager_signature=sig,
+        ))
+    db.session.commit()
+    end = start + timedelta(days=n_rows)
+    return n_rows, start, end
+
+
+def run(mode: str, per_page: int, date_from: date, date_to: date) -> tuple[float, int]:
+    include = mode == 'full'
+    db.session.expunge_all()
+    t0 = time.perf_counter()
+    records, _ = optimize_attendance_history_query(
+        date_from=date_from, date_to=date_to, page=1, per_page=per_page, is_admin=True,
+        include_signatures=include,
+    )
+    payload = json.dumps([r.to_dict(include_signatures=include) for r in records])
+    return time.perf_counter() - t0, len(payload.encode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--sig-kb', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench_history.db'))
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    app = create_app(args.db)
+    with app.app_context():
+        db.create_all()
+        rows, date_from, date_to = seed(args.rows, args.sig_kb)
+        print(f"Dữ liệu: {rows} bản ghi, mỗi chữ ký ~{args.sig_kb} KB")
+
+        for mode in ('full', 'list'):
+            timings, size = [], 0
+            for _ in range(args.repeat):
+                elapsed, size = run(mode, rows, date_from, date_to)
+                timings.append(elapsed)
+            print(f"{mode:5s}: payload {size / 1024 / 1024:8.2f} MB | "
+                  f"median {statistics.median(timings) * 1000:8.1f} ms | min {min(timings) * 1000:8.1f} ms")
+
+    os.remove(args.db)
+
+
+if __name__ == '__main__':
+    main()
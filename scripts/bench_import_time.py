@@ -0,0 +1,124 @@
+"""
+Benchmark: thời gian khởi động (import app.py) và RAM nền của 1 worker.
+
+Chạy `python -X importtime -c "import app"` trong process con sạch, đo:
+    - tổng thời gian import app
+    - RSS sau khi import (≈ RAM nền của 1 worker gunicorn trước khi nhận request)
+    - các thư viện nặng đã bị nạp sẵn (đúng ra phải = rỗng, xem utils/lazy_imports.py)
+    - top module tốn thời gian nhất theo -X importtime (cumulative)
+
+--compare: chạy thêm 1 lần nạp trước toàn bộ thư viện nặng (giống app.py trước khi import lười)
+để thấy phần chênh lệch. Kết quả được ghi thêm vào file JSONL (--record) để theo dõi qua các lần đổi code.
+
+Chạy:
+    python scripts/bench_import_time.py [--compare] [--runs 3] [--record instance/import_time_history.jsonl]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Thư viện chỉ vài route dùng; import app không được kéo chúng vào
+HEAVY_MODULES = [
+    'reportlab.pdfgen.canvas', 'reportlab.platypus', 'openpyxl', 'googleapiclient.discovery',
+    'google_auth_oauthlib.flow', 'selenium.webdriver', 'webdriver_manager', 'cv2', 'numpy', 'PIL.Image', 'requests',
+]
+
+_CHILD = r"""
+import importlib, json, os, sys, time
+preload = json.loads(os.environ['BENCH_PRELOAD'])
+started = time.perf_counter()
+for name in preload:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+import app
+elapsed = time.perf_counter() - started
+try:
+    import psutil
+    rss_mb = psutil.Process().memory_info().rss / 1024 / 1024
+except ImportError:
+    import resource
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+heavy = json.loads(os.environ['BENCH_HEAVY'])
+print(json.dumps({'seconds': elapsed, 'rss_mb': rss_mb, 'heavy_loaded': [m for m in heavy if m in sys.modules]}))
+"""
+
+
+def parse_importtime(stderr: str, top: int):
+    """Dòng -X importtime: 'import time: self [us] | cumulative | imported package'"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            _, self_us, cumulative_us, name = line.replace('import time:', '|', 1).split('|')
+            rows.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+        except ValueError:
+            continue
+    # Chỉ lấy module cấp cao nhất của mỗi nhánh (không thụt lề) để không đếm trùng
+    top_level = [r for r in rows if not r[2].startswith(' ')]
+    return sorted(top_level, reverse=True)[:top]
+
+
+def run_once(preload, top: int):
+    env = dict(os.environ, APP_SKIP_CHECK='1', BENCH_PRELOAD=json.dumps(preload), BENCH_HEAVY=json.dumps(HEAVY_MODULES))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app lỗi:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['top'] = parse_importtime(proc.stderr, top)
+    return result
+
+
+def measure(label: str, preload, runs: int, top: int) -> dict:
+    results = [run_once(preload, top) for _ in range(runs)]
+    summary = {
+        'label': label,
+        'seconds': round(statistics.median(r['seconds'] for r in results), 3),
+        'rss_mb': round(statistics.median(r['rss_mb'] for r in results), 1),
+        'heavy_loaded': results[-1]['heavy_loaded'],
+    }
+    print(f"[{label}] import app: {summary['seconds']:.3f}s | RSS {summary['rss_mb']:.1f} MB (median {runs} lần)")
+    print(f"  thư viện nặng đã nạp: {', '.join(summary['heavy_loaded']) or '(không)'}")
+    print("  top import (cumulative ms / self ms):")
+    for cumulative_us, self_us, name in results[-1]['top']:
+        print(f"    {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--compare', action='store_true', help='đo thêm trường hợp nạp trước mọi thư viện nặng')
+    parser.add_argument('--record', default=os.path.join(ROOT, 'instance', 'import_time_history.jsonl'))
+    args = parser.parse_args()
+
+    record = {'timestamp': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0]}
+    record['lazy'] = measure('lazy', [], args.runs, args.top)
+    if args.compare:
+        record['eager'] = measure('eager', HEAVY_MODULES, args.runs, args.top)
+        saved_s = record['eager']['seconds'] - record['lazy']['seconds']
+        saved_mb = record['eager']['rss_mb'] - record['lazy']['rss_mb']
+        print(f"\nTiết kiệm mỗi worker: {saved_s:.3f}s khởi động, {saved_mb:.1f} MB RSS")
+
+    if args.record:
+        os.makedirs(os.path.dirname(args.record), exist_ok=True)
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(f"Đã ghi kết quả vào {args.record}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark: tra cứu đơn nghỉ cho export Excel Full.
+
+So sánh 2 cách trên dữ liệu tổng hợp (~400 nhân viên x 25 ngày công = ~10k dòng/tháng):
+    - legacy:  1 query LeaveRequest.filter(...).first() cho mỗi dòng chấm công
+    - overlay: 1 query nạp toàn bộ đơn nghỉ + tra cứu dict theo (user_id, ngày)
+
+Chạy:
+    python scripts/bench_leave_overlay.py [--users 400] [--db bench_overlay.db]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, time as time_type, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+
+from database.models import db, User, Attendance, LeaveRequest  # noqa: E402
+from utils.leave_overlay import LeaveOverlayIndex  # noqa: E402
+
+YEAR, MONTH = 2025, 3
+MONTH_START = date(YEAR, MONTH, 1)
+MONTH_END = date(YEAR, MONTH, 31)
+
+
+def create_app(db_path: str) -> Flask:
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(n_users: int) -> int:
+    """Tạo user, chấm công đã duyệt cho mọi ngày trong tuần và ~15% đơn nghỉ"""
+    rng = random.Random(42)
+    users = []
+    for i in range(n_users):
+        users.append(User(
+            name=f"Nhân viên {i}", employee_id=100000 + i, roles='EMPLOYEE',
+            department=f"DEPT{i % 10}", password_hash='x',
+        ))
+    db.session.add_all(users)
+    db.session.flush()
+
+    workdays = [MONTH_START + timedelta(days=d) for d in range((MONTH_END - MONTH_START).days + 1)]
+    workdays = [d for d in workdays if d.weekday() < 6]
+
+    rows = 0
+    for u in users:
+        for d in workdays:
+            db.session.add(Attendance(
+                user_id=u.id, date=d, status='approved', approved=True,
+                check_in=datetime.combine(d, time_type(8, 0)),
+                check_out=datetime.combine(d, time_type(17, 0)),
+                total_work_minutes=480, regular_work_minutes=480,
+            ))
+            rows += 1
+        if rng.random() < 0.15:
+            start = rng.choice(workdays)
+            end = start + timedelta(days=rng.randint(0, 2))
+            db.session.add(LeaveRequest(
+                user_id=u.id, employee_name=u.name, team=u.department, employee_code=str(u.employee_id),
+                request_type=rng.choice(['leave', 'late_early']), late_early_type='late',
+                leave_reason='bench', status='approved',
+                leave_from_hour=8, leave_from_minute=0,
+                leave_from_day=start.day, leave_from_month=start.month, leave_from_year=start.year,
+                leave_to_hour=9, leave_to_minute=0,
+                leave_to_day=end.day, leave_to_month=end.month, leave_to_year=end.year,
+            ))
+    db.session.commit()
+    return rows
+
+
+def legacy_lookup(records):
+    hits = 0
+    for att in records:
+        y, m, d = att.date.year, att.date.month, att.date.day
+        start_cond = db.or_(
+            LeaveRequest.leave_from_year < y,
+            db.and_(LeaveRequest.leave_from_year == y, LeaveRequest.leave_from_month < m),
+            db.and_(LeaveRequest.leave_from_year == y, LeaveRequest.leave_from_month == m, LeaveRequest.leave_from_day <= d)
+        )
+        end_cond = db.or_(
+            LeaveRequest.leave_to_year > y,
+            db.and_(LeaveRequest.leave_to_year == y, LeaveRequest.leave_to_month > m),
+            db.and_(LeaveRequest.leave_to_year == y, LeaveRequest.leave_to_month == m, LeaveRequest.leave_to_day >= d)
+        )
+        leave = LeaveRequest.query.filter(
+            LeaveRequest.user_id == att.user_id, start_cond, end_cond,
+            LeaveRequest.status == 'approved'
+        ).first()
+        if leave:
+            hits += 1
+    return hits
+
+
+def overlay_lookup(records):
+    overlay = LeaveOverlayIndex.for_window(MONTH_START, MONTH_END)
+    hits = 0
+    for att in records:
+        if overlay.get(att.user_id, att.date):
+            hits += 1
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=400)
+    parser.add_argument('--db', default=os.path.join(ROOT, 'bench_overlay.db'))
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    app = create_app(args.db)
+    with app.app_context():
+        db.create_all()
+        rows = seed(args.users)
+        records = Attendance.query.filter(
+            Attendance.status == 'approved',
+            Attendance.date >= MONTH_START,
+            Attendance.date <= MONTH_END,
+        ).all()
+        print(f"Dữ liệu: {args.users} nhân viên, {rows} dòng chấm công")
+
+        t0 = time.perf_counter()
+        legacy_hits = legacy_lookup(records)
+        legacy_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        overlay_hits = overlay_lookup(records)
+        overlay_s = time.perf_counter() - t0
+
+        print(f"legacy : {legacy_s:8.3f}s  ({len(records)} queries, {legacy_hits} dòng có đơn)")
+        print(f"overlay: {overlay_s:8.3f}s  (1 query, {overlay_hits} dòng có đơn)")
+        if overlay_s > 0:
+            print(f"speedup: x{legacy_s / overlay_s:.1f}")
+        if legacy_hits != overlay_hits:
+            print("⚠️  Kết quả 2 cách KHÁC NHAU!")
+
+    os.remove(args.db)
+
+
+if __name__ == '__main__':
+    main()
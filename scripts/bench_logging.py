@@ -0,0 +1,106 @@
+"""
+Benchmark: độ trễ 1 "request" có log dày đặc (kiểu update_timesheet_for_attendance / approve_attendance).
+
+Mỗi request làm 1 ít việc giả lập rồi ghi ~50 dòng log (đa số chi tiết, vài dòng kết quả) và so sánh:
+    - legacy:  f-string + print(..., flush=True) qua _safe_print cũ, ghi thẳng ra file
+    - DEBUG:   utils.log_pipeline, mọi dòng đều được ghi (qua hàng đợi, thread listener ghi file)
+    - INFO:    mặc định - dòng chi tiết (debug) bị tắt: không format, không vào hàng đợi
+    - off:     tắt log hoàn toàn (level > CRITICAL)
+
+Chạy:
+    python scripts/bench_logging.py [--requests 3000] [--lines 50]
+"""
+
+from __future__ import annotations
+
+import argparse
+import builtins
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_TMP_DIR = tempfile.mkdtemp(prefix='bench_logging_')
+os.environ['LOG_FILE'] = os.path.join(_TMP_DIR, 'app.log')
+os.environ['LOG_CONSOLE'] = '0'
+os.environ.setdefault('LOG_REPEAT_LIMIT', '0')  # đo chi phí ghi, không đo bộ lọc lặp
+
+from utils.log_pipeline import ROOT_LOGGER, log_pipeline, setup_logging, sheets_log  # noqa: E402
+
+RECORD = {'user_name': 'Nguyễn Văn A', 'date': '2025-03-10', 'check_in': '08:00', 'check_out': '17:30',
+          'overtime_before_22': '1:30', 'leave_summary': {'annual': 0.5, 'unpaid': 0}}
+
+
+def _work(i):
+    # Việc giả lập của request (dựng payload ô cần ghi)
+    return [(f"B{row}", RECORD['check_in'], i * row) for row in range(20)]
+
+
+def legacy_request(i, lines, stream):
+    def _print(*args, **kwargs):
+        try:
+            if kwargs.get('flush', False):
+                stream.flush()
+            kwargs['file'] = stream
+            builtins.print(*args, **kwargs)
+        except Exception:
+            pass
+
+    cells = _work(i)
+    _print(f"🔵 [SHEET_UPDATE] Bắt đầu - ID: {i}, Employee: {RECORD['user_name']}", flush=True)
+    for n in range(lines - 2):
+        _print(f"   📝 Dòng {n}: ô {cells[n % len(cells)][0]} = {cells[n % len(cells)]} | data={RECORD}", flush=True)
+    _print(f"✅ [SHEET_UPDATE] Cập nhật thành công - ID: {i}, {len(cells)} ô", flush=True)
+
+
+def pipeline_request(i, lines, _stream):
+    cells = _work(i)
+    sheets_log.debug("🔵 [SHEET_UPDATE] Bắt đầu - ID: %s, Employee: %s", i, RECORD['user_name'])
+    for n in range(lines - 2):
+        sheets_log.debug("   📝 Dòng %s: ô %s = %s | data=%s", n, cells[n % len(cells)][0], cells[n % len(cells)], RECORD)
+    sheets_log.info("✅ [SHEET_UPDATE] Cập nhật thành công - ID: %s, %s ô", i, len(cells))
+
+
+def measure(handler, requests, lines, stream=None):
+    samples = []
+    for i in range(requests):
+        started = time.perf_counter()
+        handler(i, lines, stream)
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--lines', type=int, default=50, help='Số dòng log mỗi request')
+    args = parser.parse_args()
+
+    print(f"{args.requests} request x {args.lines} dòng log (µs / request)")
+    print(f"  {'chế độ':<8} {'trung bình':>11} {'p50':>9} {'p99':>9}")
+
+    with open(os.path.join(_TMP_DIR, 'legacy.log'), 'w', encoding='utf-8') as stream:
+        mean, p50, p99 = measure(legacy_request, args.requests, args.lines, stream)
+    print(f"  {'legacy':<8} {mean:11.1f} {p50:9.1f} {p99:9.1f}")
+
+    setup_logging()
+    root = logging.getLogger(ROOT_LOGGER)
+    for mode, level in (('DEBUG', logging.DEBUG), ('INFO', logging.INFO), ('off', logging.CRITICAL + 1)):
+        root.setLevel(level)
+        mean, p50, p99 = measure(pipeline_request, args.requests, args.lines)
+        stats = log_pipeline.stats()
+        print(f"  {mode:<8} {mean:11.1f} {p50:9.1f} {p99:9.1f}   (hàng đợi còn {stats['queued']}, bỏ {stats['dropped']})")
+        # Chờ listener ghi hết để lần đo sau không tranh CPU với lần trước
+        while log_pipeline.stats()['queued']:
+            time.sleep(0.05)
+    log_pipeline.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: kích thước header và chi phí serialize session mỗi request, session cookie vs session phía server.
+
+Session giả lập của 1 trưởng nhóm đang phê duyệt: user_id, roles, csrf_token, last_activity
++ chữ ký đã mã hoá (Fernet, base64) và metadata như SignatureManager.save_signature_to_session.
+Mỗi request là 1 lần poll badge: đọc session, cập nhật last_activity như update_session_activity.
+
+    - cookie / mỗi request : session cookie của Flask, ghi last_activity mọi request (trước đây)
+    - server / mỗi request : utils.session_store (SQLite), ghi last_activity mọi request
+    - server / 30s         : utils.session_store + update_session_activity chỉ ghi khi đã cũ hơn 30s (hiện tại)
+
+Chạy:
+    python scripts/bench_session_store.py [--requests 2000] [--signature-kb 12]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, session  # noqa: E402
+
+from utils.session_store import init_session_store  # noqa: E402
+
+
+def build_app(store_url, throttle_seconds):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='bench', PERMANENT_SESSION_LIFETIME=timedelta(minutes=30),
+                      SESSION_REFRESH_EACH_REQUEST=True)
+    if store_url:
+        init_session_store(app, store_url)
+
+    @app.route('/login')
+    def login():
+        session.clear()
+        session['user_id'] = 42
+        session['current_role'] = 'TEAM_LEADER'
+        session['csrf_token'] = os.urandom(20).hex()
+        session['last_activity'] = datetime.now().isoformat()
+        session['signature_42_TEAM_LEADER'] = app.config['BENCH_SIGNATURE']
+        session['signature_meta_42_TEAM_LEADER'] = {
+            'created_at': datetime.now().isoformat(), 'type': 'new', 'ip_address': '10.0.0.12',
+            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+            'expires_at': (datetime.now() + timedelta(minutes=30)).isoformat(), 'dont_ask_again': True,
+        }
+        return 'ok'
+
+    @app.route('/api/leave/pending-count')
+    def poll():
+        now = datetime.now()
+        last = session.get('last_activity')
+        if not last or (now - datetime.fromisoformat(last)).total_seconds() >= throttle_seconds:
+            session['last_activity'] = now.isoformat()
+        return {'count': 3, 'user_id': session.get('user_id')}
+
+    return app
+
+
+def measure(app, requests):
+    client = app.test_client()
+    client.get('/login')
+    samples, request_header, response_header = [], 0, 0
+    for _ in range(requests):
+        cookie = client.get_cookie(app.config.get('SESSION_COOKIE_NAME', 'session'))
+        request_header = len(f"Cookie: session={cookie.value}") if cookie else 0
+        started = time.perf_counter()
+        response = client.get('/api/leave/pending-count')
+        samples.append((time.perf_counter() - started) * 1e6)
+        set_cookie = response.headers.get('Set-Cookie')
+        response_header = max(response_header, len(f"Set-Cookie: {set_cookie}") if set_cookie else 0)
+    samples.sort()
+    return request_header, response_header, statistics.mean(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--signature-kb', type=int, default=12, help='Kích thước ảnh chữ ký PNG trước khi mã hoá')
+    args = parser.parse_args()
+
+    # Fernet(base64(png)) ~ 1.33 * 1.33 kích thước gốc
+    signature = base64.urlsafe_b64encode(os.urandom(int(args.signature_kb * 1024 * 4 / 3))).decode()
+    tmp_dir = tempfile.mkdtemp(prefix='bench_session_')
+    warnings.filterwarnings('ignore', message='.*cookie is too large')
+
+    print(f"{args.requests} request poll, chữ ký {len(signature) / 1024:.1f} KB sau mã hoá")
+    print(f"  {'chế độ':<20} {'Cookie (B)':>11} {'Set-Cookie (B)':>15} {'µs/request':>11} {'p99':>9}")
+    for label, url, throttle in (('cookie / mỗi request', None, 0),
+                                 ('server / mỗi request', f"sqlite:///{tmp_dir}/a.db", 0),
+                                 ('server / 30s', f"sqlite:///{tmp_dir}/b.db", 30)):
+        app = build_app(url, throttle)
+        app.config['BENCH_SIGNATURE'] = signature
+        request_header, response_header, mean, p99 = measure(app, args.requests)
+        print(f"  {label:<20} {request_header:>11} {response_header:>15} {mean:>11.1f} {p99:>9.1f}")
+    print("  (trình duyệt bỏ cookie > 4096 byte - chữ ký lưu trong session cookie sẽ mất)")
+
+
+if __name__ == '__main__':
+    main()
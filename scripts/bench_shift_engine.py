@@ -0,0 +1,102 @@
+"""
+Benchmark: tính giờ công / tăng ca cho nhiều bản ghi chấm công.
+
+So sánh trên cùng lưới bản ghi của scripts/check_shift_engine_golden.py:
+    - legacy: Attendance.update_work_hours + calculate_regular_work_hours cũ (lấy từ git, --legacy-rev)
+    - engine: utils.shift_engine.compute_work_hours + calculate_regular_hours từng bản ghi
+    - batch:  utils.shift_engine.compute_minutes_batch trên mảng phút (chỉ các bản ghi có ca)
+
+Chạy:
+    python scripts/bench_shift_engine.py [--rows 100000] [--legacy-rev <rev>]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, time as time_type
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+from check_shift_engine_golden import generate_cases, load_legacy_class  # noqa: E402
+from utils.shift_engine import (  # noqa: E402
+    DAY_NORMAL, DAY_TYPE_CODES, ShiftInput, calculate_regular_hours, compute_minutes_batch, compute_work_hours,
+)
+
+
+def run_legacy(legacy_class, cases):
+    for case in cases:
+        fields = dict(case)
+        record = legacy_class(user=SimpleNamespace(is_maternity_flex=fields.pop('is_maternity_flex')), **fields)
+        try:
+            record.update_work_hours()
+            record.calculate_regular_work_hours()
+        except TypeError:
+            pass
+
+
+def run_engine(inputs):
+    for inp in inputs:
+        try:
+            res = compute_work_hours(inp)
+            calculate_regular_hours(inp._replace(**res._asdict()))
+        except TypeError:
+            pass
+
+
+def batch_columns(cases):
+    rows = [c for c in cases if c['check_in'] and c['check_out'] and c['shift_code']
+            and not c['shift_start'] and not c['shift_end']]
+    day_start = datetime.combine(rows[0]['date'], time_type())
+    minutes = lambda dt: int((dt - day_start).total_seconds() // 60)  # noqa: E731
+    return len(rows), dict(
+        check_in=[minutes(c['check_in']) for c in rows],
+        check_out=[minutes(c['check_out']) for c in rows],
+        shift_code=[c['shift_code'] for c in rows],
+        day_type=[DAY_TYPE_CODES.get(c['holiday_type'], DAY_NORMAL) for c in rows],
+        break_minutes=[int(round(c['break_time'] * 60)) for c in rows],
+        comp_regular=[c['comp_time_regular_minutes'] for c in rows],
+        comp_overtime=[c['comp_time_overtime_minutes'] for c in rows],
+        comp_before_22=[c['comp_time_ot_before_22_minutes'] for c in rows],
+        comp_after_22=[c['comp_time_ot_after_22_minutes'] for c in rows],
+        maternity=[c['is_maternity_flex'] for c in rows],
+    )
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--legacy-rev', help='Revision git chứa Attendance.update_work_hours cũ để so sánh')
+    args = parser.parse_args()
+
+    cases = generate_cases(args.rows)
+    print(f"Dữ liệu: {len(cases)} bản ghi chấm công")
+
+    if args.legacy_rev:
+        legacy_class = load_legacy_class(args.legacy_rev)
+        elapsed = timed(run_legacy, legacy_class, cases)
+        print(f"  legacy : {elapsed:7.3f}s | {len(cases) / elapsed:10.0f} bản ghi/s")
+
+    inputs = [ShiftInput(**case) for case in cases]
+    elapsed = timed(run_engine, inputs)
+    print(f"  engine : {elapsed:7.3f}s | {len(cases) / elapsed:10.0f} bản ghi/s")
+
+    n_batch, columns = batch_columns(cases)
+    compute_minutes_batch(**{k: v[:10] for k, v in columns.items()})  # nạp NumPy trước khi đo
+    elapsed = timed(lambda: compute_minutes_batch(**columns))
+    print(f"  batch  : {elapsed:7.3f}s | {n_batch / elapsed:10.0f} bản ghi/s ({n_batch} bản ghi có ca)")
+
+
+if __name__ == '__main__':
+    main()
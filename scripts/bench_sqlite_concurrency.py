@@ -0,0 +1,182 @@
+"""
+Benchmark: đọc + ghi đồng thời trên SQLite, cấu hình cũ so với profile của utils/sqlite_tuning.py.
+
+Mô phỏng tải thật của 1 worker:
+    - reader: truy vấn lịch sử chấm công (join users, lọc theo tháng, phân trang 50 dòng)
+    - writer: duyệt từng bản ghi (cập nhật status/approved/version rồi commit), giống luồng phê duyệt
+
+2 profile, mỗi profile dùng 1 file DB mới:
+    legacy : pool_size=10/max_overflow=20, pre-ping, journal DELETE, không busy_timeout
+    tuned  : sqlite_engine_options() + install_sqlite_pragmas() (WAL, NORMAL, busy_timeout...)
+
+Chạy:
+    python scripts/bench_sqlite_concurrency.py [--readers 8] [--writers 2] [--seconds 10] [--users 200]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import date, datetime, time as time_type, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from database.models import db, User, Attendance  # noqa: E402
+from utils.sqlite_tuning import install_sqlite_pragmas, read_sqlite_pragmas, sqlite_engine_options  # noqa: E402
+
+YEAR, MONTH = 2025, 3
+MONTH_START = date(YEAR, MONTH, 1)
+MONTH_END = date(YEAR, MONTH, 31)
+
+LEGACY_ENGINE_OPTIONS = {
+    'pool_pre_ping': True,
+    'pool_recycle': 300,
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    # Driver sqlite3 mặc định chờ 5s; cấu hình cũ không đặt gì thêm
+}
+
+
+def create_app(db_path: str, profile: str) -> Flask:
+    app = Flask(__name__)
+    uri = f"sqlite:///{db_path}"
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(uri) if profile == 'tuned' else LEGACY_ENGINE_OPTIONS
+    db.init_app(app)
+    if profile == 'tuned':
+        with app.app_context():
+            install_sqlite_pragmas(db.engine)
+    return app
+
+
+def seed(n_users: int) -> None:
+    users = [
+        User(name=f"Nhân viên {i}", employee_id=200000 + i, roles='EMPLOYEE',
+             department=f"DEPT{i % 10}", password_hash='x')
+        for i in range(n_users)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    for u in users:
+        for offset in range((MONTH_END - MONTH_START).days + 1):
+            d = MONTH_START + timedelta(days=offset)
+            if d.weekday() >= 6:
+                continue
+            db.session.add(Attendance(
+                user_id=u.id, date=d, status='pending_manager',
+                check_in=datetime.combine(d, time_type(8, 0)),
+                check_out=datetime.combine(d, time_type(17, 0)),
+                total_work_minutes=480, regular_work_minutes=480,
+            ))
+    db.session.commit()
+
+
+def reader_loop(app: Flask, stop: threading.Event, latencies: list, errors: list) -> None:
+    rng = random.Random()
+    with app.app_context():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                page = rng.randint(0, 20)
+                (Attendance.query.join(User, Attendance.user_id == User.id)
+                 .filter(Attendance.date >= MONTH_START, Attendance.date <= MONTH_END,
+                         User.department == f"DEPT{rng.randint(0, 9)}")
+                 .order_by(Attendance.date.desc(), Attendance.id.desc())
+                 .offset(page * 50).limit(50).all())
+                latencies.append(time.perf_counter() - started)
+            except OperationalError as e:
+                errors.append(str(e.orig))
+            finally:
+                db.session.remove()
+
+
+def writer_loop(app: Flask, stop: threading.Event, latencies: list, errors: list, ids: list) -> None:
+    rng = random.Random()
+    with app.app_context():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                attendance = db.session.get(Attendance, rng.choice(ids))
+                attendance.status = 'approved' if attendance.status != 'approved' else 'pending_manager'
+                attendance.approved = attendance.status == 'approved'
+                attendance.approved_at = datetime.utcnow()
+                attendance.version = (attendance.version or 1) + 1
+                db.session.commit()
+                latencies.append(time.perf_counter() - started)
+            except OperationalError as e:
+                db.session.rollback()
+                errors.append(str(e.orig))
+            finally:
+                db.session.remove()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def run_profile(profile: str, args) -> None:
+    db_path = os.path.join(ROOT, f"bench_concurrency_{profile}.db")
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    app = create_app(db_path, profile)
+    with app.app_context():
+        db.create_all()
+        seed(args.users)
+        ids = [row[0] for row in db.session.query(Attendance.id).all()]
+        pragmas = read_sqlite_pragmas(db.session.connection())
+        db.session.remove()
+
+    stop = threading.Event()
+    read_lat, write_lat, read_err, write_err = [], [], [], []
+    threads = [threading.Thread(target=reader_loop, args=(app, stop, read_lat, read_err)) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer_loop, args=(app, stop, write_lat, write_err, ids)) for _ in range(args.writers)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"\n[{profile}] pragma: {pragmas}")
+    print(f"  đọc : {len(read_lat) / args.seconds:8.1f} truy vấn/s | p50 {statistics.median(read_lat or [0]) * 1000:6.1f}ms"
+          f" | p95 {percentile(read_lat, 0.95) * 1000:6.1f}ms | lỗi {len(read_err)}")
+    print(f"  ghi : {len(write_lat) / args.seconds:8.1f} commit/s   | p50 {statistics.median(write_lat or [0]) * 1000:6.1f}ms"
+          f" | p95 {percentile(write_lat, 0.95) * 1000:6.1f}ms | lỗi {len(write_err)}")
+    locked = sum('locked' in e for e in read_err + write_err)
+    if locked:
+        print(f"  'database is locked': {locked}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--profile', choices=['legacy', 'tuned', 'both'], default='both')
+    args = parser.parse_args()
+
+    profiles = ['legacy', 'tuned'] if args.profile == 'both' else [args.profile]
+    print(f"{args.readers} reader + {args.writers} writer trong {args.seconds:.0f}s, {args.users} nhân viên")
+    for profile in profiles:
+        run_profile(profile, args)
+
+
+if __name__ == '__main__':
+    main()
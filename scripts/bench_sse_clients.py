@@ -0,0 +1,176 @@
+"""
+Load test: nhiều client SSE đồng thời trên 1 worker dùng utils.sse_broker.
+
+Script tự chạy 1 server con (app Flask tối giản, cùng iter_sse_stream như /sse/email-status),
+mở N kết nối SSE bằng socket non-blocking trong 1 thread (selectors), rồi publish M sự kiện
+và đo độ trễ từ lúc publish tới lúc mọi client nhận được.
+
+    --server gevent   : gevent WSGIServer (mỗi stream là 1 greenlet) - cách chạy khuyến nghị
+    --server threaded : werkzeug threaded (mỗi stream giữ 1 OS thread) để so sánh
+
+Chạy:
+    python scripts/bench_sse_clients.py [--clients 500] [--events 20] [--server gevent]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# ---------------------------------------------------------------------- #
+# Server con
+# ---------------------------------------------------------------------- #
+def serve(port: int, server: str) -> None:
+    if server == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    import threading
+
+    from flask import Flask, Response, jsonify, request
+
+    from utils.sse_broker import create_sse_broker, iter_sse_stream
+
+    broker = create_sse_broker()
+    app = Flask(__name__)
+
+    @app.route('/sse/<channel>')
+    def sse(channel):
+        stream = iter_sse_stream(broker, channel, 'bench', keepalive=15)
+        return Response(stream, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    @app.route('/publish/<channel>', methods=['POST'])
+    def publish(channel):
+        broker.publish(channel, request.get_json())
+        return jsonify({'ok': True})
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(dict(broker.stats(), threads=threading.active_count()))
+
+    if server == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('127.0.0.1', port), app, log=None).serve_forever()
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def _get_json(url: str, data: dict | None = None) -> dict:
+    body = json.dumps(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def wait_for_server(base: str, timeout: float = 15) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _get_json(f"{base}/stats")
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server con không khởi động được")
+
+
+# ---------------------------------------------------------------------- #
+# Client SSE (non-blocking, 1 thread cho mọi kết nối)
+# ---------------------------------------------------------------------- #
+class SSEClient:
+    def __init__(self, port: int, channel: str):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.sendall(f"GET /sse/{channel} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n".encode())
+        self.sock.setblocking(False)
+        self.buffer = b''
+        self.ready = False  # đã nhận header + dòng "retry:"
+        self.latencies = []
+
+    def feed(self, data: bytes, now: float) -> None:
+        self.buffer += data
+        if not self.ready and b'retry:' in self.buffer:
+            self.ready = True
+        while b'\n\n' in self.buffer:
+            block, self.buffer = self.buffer.split(b'\n\n', 1)
+            for line in block.split(b'\n'):
+                if line.startswith(b'data: '):
+                    payload = json.loads(line[6:])
+                    self.latencies.append(now - payload['ts'])
+
+
+def run(clients: int, events: int, server: str, port: int) -> None:
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--server', server, '--port', str(port)])
+    base = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_server(base)
+        sel = selectors.DefaultSelector()
+        conns = []
+        t0 = time.perf_counter()
+        for _ in range(clients):
+            client = SSEClient(port, 'bench')
+            sel.register(client.sock, selectors.EVENT_READ, client)
+            conns.append(client)
+
+        def pump(until: float, stop=lambda: False) -> None:
+            while time.time() < until and not stop():
+                for key, _ in sel.select(timeout=0.05):
+                    try:
+                        data = key.fileobj.recv(65536)
+                    except BlockingIOError:
+                        continue
+                    if data:
+                        key.data.feed(data, time.time())
+
+        pump(time.time() + 30, stop=lambda: all(c.ready for c in conns))
+        connected = sum(c.ready for c in conns)
+        connect_s = time.perf_counter() - t0
+        print(f"[{server}] {connected}/{clients} client đã kết nối sau {connect_s:.2f}s")
+        print(f"  server: {_get_json(f'{base}/stats')}")
+
+        for i in range(events):
+            _get_json(f"{base}/publish/bench", {'seq': i, 'ts': time.time()})
+            pump(time.time() + 0.05)
+        expected = connected * events
+        pump(time.time() + 10, stop=lambda: sum(len(c.latencies) for c in conns) >= expected)
+
+        latencies = sorted(l for c in conns for l in c.latencies)
+        if latencies:
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(f"  nhận {len(latencies)}/{expected} sự kiện | độ trễ p50 {statistics.median(latencies) * 1000:.1f}ms"
+                  f" | p95 {p95 * 1000:.1f}ms | max {latencies[-1] * 1000:.1f}ms")
+        for c in conns:
+            c.sock.close()
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--events', type=int, default=20)
+    parser.add_argument('--server', choices=['gevent', 'threaded'], default='gevent')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.server)
+    else:
+        run(args.clients, args.events, args.server, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Kiểm tra query plan: mọi truy vấn theo nhóm (TEAM_LEADER / cùng phòng ban) dùng idx_user_department_key
+
+Dựng DB SQLite trong bộ nhớ từ database.models (db.create_all), sinh dữ liệu giả lập
+(nhiều phòng ban, tên có dấu / hoa thường / khoảng trắng lẫn lộn), chạy ANALYZE rồi với từng truy vấn:
+    - EXPLAIN QUERY PLAN phải có idx_user_department_key và không SCAN bảng users
+    - kết quả phải khớp cách so sánh trong Python (normalize_department)
+
+    optimize_pending_attendance_query  : gọi thẳng hàm trong utils/query_optimizer (bắt câu SQL thật)
+    approve_all_attendances / approve_all_leave_requests / danh sách đơn nghỉ / tìm trưởng nhóm,
+    quản lý (app.py)                    : dựng lại đúng biểu thức lọc dùng trong app.py
+
+Kèm plan của cách cũ (upper(trim(department))) để so sánh.
+
+Chạy:
+    python scripts/check_department_key_plans.py [--users 3000] [--departments 40]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import event, func, text  # noqa: E402
+
+from database.models import Attendance, LeaveRequest, User, db, normalize_department  # noqa: E402
+
+INDEX = 'idx_user_department_key'
+DEPARTMENTS = ('Kỹ thuật', 'Điện', 'Sản xuất', 'Kế toán', 'Hành chính', 'Bảo trì', 'Chất lượng', 'Kho')
+
+
+def build_app():
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    return app
+
+
+def _spelling(rng, name):
+    # Cùng 1 phòng ban nhưng nhập khác nhau (Excel / form): hoa thường, khoảng trắng thừa
+    return rng.choice((name, name.upper(), name.lower(), f" {name}", f"{name} "))
+
+
+def seed(users, departments, rng):
+    names = [f"{DEPARTMENTS[i % len(DEPARTMENTS)]} {i // len(DEPARTMENTS) + 1}" for i in range(departments)]
+    db.session.add_all(
+        User(id=i, name=f"NV {i}", employee_id=10000 + i, password_hash='x', roles='EMPLOYEE',
+             department=_spelling(rng, rng.choice(names)), is_deleted=rng.random() < 0.05)
+        for i in range(1, users + 1)
+    )
+    db.session.flush()
+    day = date(2025, 1, 1)
+    attendances, leaves = [], []
+    for user_id in range(1, users + 1):
+        for n in range(15):
+            status = rng.choice(('approved', 'approved', 'approved', 'pending', 'pending_manager', 'pending_admin'))
+            attendances.append({'user_id': user_id, 'date': day + timedelta(days=n), 'status': status,
+                                'approved': status == 'approved', 'holiday_type': 'normal'})
+        for n in range(2):
+            leaves.append({'user_id': user_id, 'employee_name': f"NV {user_id}", 'team': '', 'employee_code': '',
+                           'leave_reason': 'x', 'status': rng.choice(('approved', 'pending', 'pending_manager')),
+                           'leave_from_hour': 8, 'leave_from_minute': 0, 'leave_from_day': 1 + n,
+                           'leave_from_month': 1, 'leave_from_year': 2025, 'leave_to_hour': 17,
+                           'leave_to_minute': 0, 'leave_to_day': 1 + n, 'leave_to_month': 1,
+                           'leave_to_year': 2025})
+    db.session.execute(Attendance.__table__.insert(), attendances)
+    db.session.execute(LeaveRequest.__table__.insert(), leaves)
+    db.session.commit()
+    db.session.execute(text('ANALYZE'))
+    return names
+
+
+def explain(statement, params):
+    rows = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", tuple(params)).fetchall()
+    return [row[-1] for row in rows]
+
+
+def plan_of(query):
+    compiled = query.statement.compile(db.engine, compile_kwargs={'render_postcompile': True})
+    return explain(str(compiled), [compiled.params[name] for name in compiled.positiontup])
+
+
+def capture(callback):
+    """Câu SQL (kèm tham số) mà callback thực sự chạy"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        result = callback()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return result, statements
+
+
+def uses_index(plan):
+    return any(INDEX in line for line in plan) and not any(
+        line.startswith('SCAN') and ' users' in f" {line.split(' USING')[0]}" for line in plan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--departments', type=int, default=40)
+    args = parser.parse_args()
+
+    rng = random.Random(20251017)
+    app = build_app()
+    failures = 0
+    with app.app_context():
+        db.create_all()
+        names = seed(args.users, args.departments, rng)
+        department = '  ' + names[1].upper()  # Trưởng nhóm nhập khác hoa thường / khoảng trắng
+        leader = SimpleNamespace(department=department)
+        expected_ids = {u.id for u in User.query.filter_by(is_deleted=False)
+                        if normalize_department(u.department) == normalize_department(department)}
+
+        checks = []
+
+        from utils.query_optimizer import optimize_pending_attendance_query
+        (records, total), statements = capture(lambda: optimize_pending_attendance_query(
+            'TEAM_LEADER', leader, page=1, per_page=20))
+        expected_total = Attendance.query.filter(
+            Attendance.approved == False, Attendance.status == 'pending',  # noqa: E712
+            Attendance.user_id.in_(expected_ids)).count()
+        team_statements = [(s, p) for s, p in statements if 'department_key' in s]
+        checks.append(('query_optimizer TEAM_LEADER (COUNT + trang)',
+                       [explain(s, p) for s, p in team_statements],
+                       total == expected_total and all(r.user_id in expected_ids for r in records)
+                       and len(team_statements) >= 2))
+
+        shapes = (
+            ('approve_all_attendances TEAM_LEADER',
+             Attendance.query.filter(Attendance.approved == False,  # noqa: E712
+                                     Attendance.status.in_(('pending',)),
+                                     Attendance.user_id.in_(User.team_ids(department))),
+             lambda rows: {r.user_id for r in rows} <= expected_ids),
+            ('approve_all_leave_requests TEAM_LEADER',
+             LeaveRequest.query.filter(LeaveRequest.status.in_(('pending',)),
+                                       LeaveRequest.user_id.in_(User.team_ids(department))),
+             lambda rows: {r.user_id for r in rows} <= expected_ids),
+            ('leave_requests_list TEAM_LEADER',
+             LeaveRequest.query.filter(LeaveRequest.status == 'pending',
+                                       LeaveRequest.user_id.in_(User.team_ids(department)))
+             .order_by(LeaveRequest.created_at.desc()),
+             lambda rows: {r.user_id for r in rows} <= expected_ids),
+            ('create_request: tìm trưởng nhóm',
+             User.query.filter(User.in_department(department), User.roles == 'TEAM_LEADER',
+                               User.is_deleted == False),  # noqa: E712
+             lambda rows: True),
+            ('approve_request: tìm quản lý',
+             User.query.filter(User.in_department(department), User.roles.like('%MANAGER%'),
+                               User.is_deleted == False),  # noqa: E712
+             lambda rows: True),
+            ('nhân viên cùng phòng ban',
+             User.query.filter(User.in_department(department), User.is_deleted == False),  # noqa: E712
+             lambda rows: {r.id for r in rows} == expected_ids),
+        )
+        for label, query, validate in shapes:
+            checks.append((label, [plan_of(query)], validate(query.all())))
+
+        print(f"{args.users} user / {args.departments} phòng ban, trưởng nhóm: {department!r} "
+              f"-> {len(expected_ids)} nhân viên")
+        for label, plans, correct in checks:
+            ok = correct and bool(plans) and all(uses_index(plan) for plan in plans)
+            failures += not ok
+            print(f"  [{'OK' if ok else 'FAIL'}] {label}{'' if correct else ' (kết quả sai)'}")
+            for plan in plans:
+                for line in plan:
+                    print(f"         {line}")
+
+        legacy = Attendance.query.filter(
+            Attendance.approved == False, Attendance.status == 'pending',  # noqa: E712
+            Attendance.user_id.in_(db.session.query(User.id).filter(
+                func.upper(func.trim(User.department)) == normalize_department(department),
+                User.is_deleted == False).scalar_subquery()))  # noqa: E712
+        print("  (cách cũ upper(trim(department)) để so sánh)")
+        for line in plan_of(legacy):
+            print(f"         {line}")
+
+    print('OK' if not failures else f"{failures} truy vấn không dùng {INDEX}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Kiểm tra utils/email_outbox.py với 1 server SMTP cục bộ (aiosmtpd nếu có, không thì smtpd của stdlib)
+
+    1. 50 email -> gửi hết, cùng 1 kết nối SMTP; so thời gian với cách cũ (mỗi email 1 kết nối)
+    2. Server trả 451 cho 1 email -> email đó 'pending' + next_retry_at, lần sau gửi được
+    3. Server trả 550 cho 1 người nhận -> email đó 'failed' ngay, email sau vẫn gửi trên kết nối cũ
+    4. Kết nối bị ngắt giữa chừng -> mở lại và gửi lại 1 lần
+    5. Trạng thái sending -> success / error tới on_status và SSE (kênh email:<user_id>) ngay khi gửi xong
+    6. Kết quả từng email được commit trước khi publish, các email chưa gửi trong lô được gia hạn lease
+    7. INSERT vào outbox lỗi -> trạng thái 'error' (không kẹt ở 'sending')
+
+Server thử nghiệm không có STARTTLS / AUTH nên chạy với SMTP_STARTTLS=0 và không đặt SMTP_USER.
+
+Chạy:
+    python scripts/check_email_outbox.py [--messages 50]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import smtplib
+import socket
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+from email.mime.text import MIMEText
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ['SMTP_STARTTLS'] = '0'
+os.environ['SSE_BROKER_URL'] = 'memory://'
+for _name in ('SMTP_USER', 'SMTP_PASSWORD'):
+    os.environ.pop(_name, None)
+
+from flask import Flask  # noqa: E402
+
+from database.models import EmailOutboxMessage, db  # noqa: E402
+from utils.email_outbox import (  # noqa: E402
+    KIND_LEAVE_REQUEST, STATE_FAILED, STATE_PENDING, STATE_SENT, EmailOutbox, email_status_channel,
+)
+from utils.sse_broker import sse_broker  # noqa: E402
+
+
+class Mailbox:
+    """Email server nhận được + lỗi cài sẵn cho các lần DATA / RCPT kế tiếp"""
+
+    def __init__(self):
+        self.messages = []  # (peer, mail_from, rcpt_tos)
+        self.fail_next_data = []  # vd: ['451 4.3.0 Try again later']
+        self.reject_rcpt = {}  # địa chỉ -> '550 ...'
+        self.lock = threading.Lock()
+
+    def connections(self):
+        return len({peer for peer, _, _ in self.messages})
+
+
+def start_server(mailbox):
+    """Trả về (port, stop)"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        Controller = None
+
+    if Controller is not None:
+        class Handler:
+            async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+                if address in mailbox.reject_rcpt:
+                    return mailbox.reject_rcpt[address]
+                envelope.rcpt_tos.append(address)
+                return '250 OK'
+
+            async def handle_DATA(self, server, session, envelope):
+                with mailbox.lock:
+                    if mailbox.fail_next_data:
+                        return mailbox.fail_next_data.pop(0)
+                    mailbox.messages.append((session.peer, envelope.mail_from, list(envelope.rcpt_tos)))
+                return '250 Message accepted for delivery'
+
+        controller = Controller(Handler(), hostname='127.0.0.1', port=port)
+        controller.start()
+        return port, controller.stop
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import asyncore
+        import smtpd
+
+    class Channel(smtpd.SMTPChannel):
+        def smtp_RCPT(self, arg):
+            address = self._getaddr(arg.partition(':')[2].strip())[0] if arg else None
+            if address in mailbox.reject_rcpt:
+                self.push(mailbox.reject_rcpt[address])
+                return
+            super().smtp_RCPT(arg)
+
+    class Server(smtpd.SMTPServer):
+        channel_class = Channel
+
+        def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+            with mailbox.lock:
+                if mailbox.fail_next_data:
+                    return mailbox.fail_next_data.pop(0)
+                mailbox.messages.append((peer, mailfrom, list(rcpttos)))
+            return None
+
+    server = Server(('127.0.0.1', port), None, decode_data=False)
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05}, daemon=True)
+    thread.start()
+
+    def stop():
+        server.close()
+        thread.join(1)
+
+    return port, stop
+
+
+def make_message(i, to='hr@example.com'):
+    msg = MIMEText(f"Đơn nghỉ #{i}\n" + 'Nội dung thông báo. ' * 50, 'plain', 'utf-8')
+    msg['Subject'] = f"[TẠO ĐƠN] [ĐƠN NGHỈ PHÉP] Nhân viên {i}"
+    msg['From'] = 'system@example.com'
+    msg['To'] = to
+    return msg
+
+
+def drain(outbox):
+    while outbox.run_once():
+        pass
+
+
+def legacy_send(port, count):
+    """Cách cũ: mỗi email 1 kết nối SMTP mới"""
+    started = time.perf_counter()
+    for i in range(count):
+        with smtplib.SMTP('127.0.0.1', port) as server:
+            server.send_message(make_message(i))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=50)
+    args = parser.parse_args()
+
+    mailbox = Mailbox()
+    port, stop = start_server(mailbox)
+    os.environ['SMTP_SERVER'] = '127.0.0.1'
+    os.environ['SMTP_PORT'] = str(port)
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tempfile.mkdtemp(prefix='email_outbox_')}/outbox.db",
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    statuses = []
+    # (request_id, state của dòng trong DB, updated_at nhỏ nhất của các dòng còn 'sending') lúc publish 'success'
+    committed = []
+
+    def on_status(request_id, status, message):
+        statuses.append((request_id, status))
+        if status == 'success':
+            with app.app_context():
+                state = EmailOutboxMessage.query.filter_by(request_id=request_id).one().state
+                oldest = db.session.query(db.func.min(EmailOutboxMessage.updated_at)) \
+                    .filter(EmailOutboxMessage.state == 'sending').scalar()
+            committed.append((request_id, state, oldest))
+
+    outbox = EmailOutbox()
+    outbox.init_app(app, on_status=on_status)
+    sub = sse_broker.subscribe(email_status_channel(7))
+    failures = []
+
+    def check(label, condition, detail=''):
+        print(f"  [{'OK' if condition else 'FAIL'}] {label}{(' - ' + detail) if detail else ''}")
+        if not condition:
+            failures.append(label)
+
+    def rows():
+        with app.app_context():
+            return {r.id: r for r in EmailOutboxMessage.query.all()}
+
+    print(f"Server SMTP cục bộ 127.0.0.1:{port}")
+
+    # 1. Gửi theo lô trên 1 kết nối
+    # enqueue đánh thức worker thread -> tính thời gian từ email đầu tiên tới khi gửi hết
+    started = time.perf_counter()
+    for i in range(args.messages):
+        outbox.enqueue(make_message(i), 'system@example.com', ['hr@example.com'], KIND_LEAVE_REQUEST,
+                       request_id=1000 + i, user_id=7)
+    drain(outbox)
+    pooled = time.perf_counter() - started
+    sent = [r for r in rows().values() if r.state == STATE_SENT]
+    check(f"{args.messages} email đã gửi", len(sent) == args.messages and len(mailbox.messages) == args.messages)
+    check('dùng 1 kết nối SMTP', outbox.stats()['smtp_connects'] == 1 and mailbox.connections() == 1,
+          f"{outbox.stats()['smtp_connects']} kết nối")
+    mailbox.messages.clear()
+    legacy = legacy_send(port, args.messages)
+    print(f"         outbox: {pooled * 1000:.1f} ms, cách cũ (mỗi email 1 kết nối): {legacy * 1000:.1f} ms "
+          f"(server cục bộ không TLS / login - thực tế mỗi kết nối còn thêm STARTTLS + AUTH)")
+    mailbox.messages.clear()
+
+    events = []
+    while True:
+        event = sub.get(timeout=0)
+        if event is None:
+            break
+        events.append(event)
+    by_request = {}
+    for event in events:
+        by_request.setdefault(event['request_id'], []).append(event['status'])
+    check('SSE: sending rồi success cho từng email', len(by_request) == args.messages
+          and all(seq == ['sending', 'success'] for seq in by_request.values()))
+    check('on_status nhận đủ trạng thái', len(statuses) == 2 * args.messages)
+    check('mỗi email commit "sent" trước khi publish success', len(committed) == args.messages
+          and all(state == STATE_SENT for _, state, _ in committed))
+    renewals = [oldest for _, _, oldest in committed if oldest is not None]
+    check('lease các email chưa gửi trong lô được gia hạn sau mỗi email',
+          len(renewals) > 1 and renewals == sorted(renewals) and renewals[0] < renewals[-1])
+
+    # 2. 451 -> thử lại
+    mailbox.fail_next_data.append('451 4.3.0 Try again later')
+    retry_id = outbox.enqueue(make_message('retry'), 'system@example.com', ['hr@example.com'], KIND_LEAVE_REQUEST,
+                              request_id=2000, user_id=7)
+    outbox.run_once()
+    row = rows()[retry_id]
+    check('451: email về pending, có next_retry_at', row.state == STATE_PENDING and row.attempts == 1
+          and row.next_retry_at > datetime.utcnow(), row.last_error or '')
+    with app.app_context():
+        EmailOutboxMessage.query.filter_by(id=retry_id).update({'next_retry_at': datetime.utcnow()})
+        db.session.commit()
+    drain(outbox)
+    row = rows()[retry_id]
+    check('451: lần thử sau gửi được', row.state == STATE_SENT and row.attempts == 2)
+    check('trạng thái 451: sending -> sending (thử lại) -> success',
+          [s for r, s in statuses if r == 2000] == ['sending', 'sending', 'success'])
+
+    # 3. 550 cho 1 người nhận -> failed ngay, email sau vẫn đi trên kết nối cũ
+    connects_before = outbox.stats()['smtp_connects']
+    mailbox.reject_rcpt['nobody@example.com'] = '550 5.1.1 No such user'
+    bad_id = outbox.enqueue(make_message('bad', 'nobody@example.com'), 'system@example.com', ['nobody@example.com'],
+                            KIND_LEAVE_REQUEST, request_id=3000, user_id=7)
+    good_id = outbox.enqueue(make_message('good'), 'system@example.com', ['hr@example.com'], KIND_LEAVE_REQUEST,
+                             request_id=3001, user_id=7)
+    drain(outbox)
+    current = rows()
+    check('550: email lỗi -> failed ngay (1 lần thử)', current[bad_id].state == STATE_FAILED
+          and current[bad_id].attempts == 1)
+    check('550: email sau vẫn gửi, không mở kết nối mới', current[good_id].state == STATE_SENT
+          and outbox.stats()['smtp_connects'] == connects_before)
+
+    # 4. Kết nối bị ngắt -> mở lại, gửi lại 1 lần
+    outbox._connection._smtp.close()
+    drop_id = outbox.enqueue(make_message('drop'), 'system@example.com', ['hr@example.com'], KIND_LEAVE_REQUEST)
+    drain(outbox)
+    check('mất kết nối: mở lại và gửi được', rows()[drop_id].state == STATE_SENT
+          and outbox.stats()['smtp_reconnects'] == 1)
+
+    # 7. INSERT lỗi -> 'error'
+    original_session = outbox._session
+    outbox._session = lambda: (_ for _ in ()).throw(RuntimeError('database is locked'))
+    try:
+        outbox.enqueue(make_message('insert-fail'), 'system@example.com', ['hr@example.com'], KIND_LEAVE_REQUEST,
+                       request_id=4000, user_id=7)
+    except RuntimeError:
+        pass
+    outbox._session = original_session
+    check("INSERT lỗi: sending -> error", [s for r, s in statuses if r == 4000] == ['sending', 'error'])
+
+    sub.close()
+    outbox._connection.close()
+    stop()
+    print('OK' if not failures else f"{len(failures)} kiểm tra lỗi")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Kiểm tra golden cho utils/shift_engine.py
+
+Sinh lưới bản ghi chấm công tất định (mọi loại ngày, ca 1-5 / ca tuỳ chỉnh / không ca, qua đêm,
+giây lẻ, đối ứng, mẹ <12 tháng...) rồi so kết quả của bộ tính với đầu ra đã chốt trong
+scripts/golden/shift_engine_golden.json - sinh từ Attendance.update_work_hours /
+calculate_regular_work_hours cũ. So sánh chính xác (repr, kể cả kiểu int/float và lỗi ném ra).
+
+Ngoại lệ có chủ đích: cuối tuần / lễ Nhật không có ca chuẩn - code cũ trừ 2 giá trị time nên luôn
+ném TypeError; bộ tính mới tính trên datetime. Với các case này file golden lưu đầu ra của bộ tính mới
+(danh sách index trong khoá 'engine_overrides').
+
+Kèm kiểm tra compute_minutes_batch với kết quả từng bản ghi (các ca có giờ ra/vào tròn phút).
+
+Chạy:
+    python scripts/check_shift_engine_golden.py
+    # So trực tiếp với code cũ ở 1 revision git (và ghi lại file golden nếu cần):
+    python scripts/check_shift_engine_golden.py --legacy-rev <rev> [--write]
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+from datetime import date, datetime, time, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.shift_engine import (  # noqa: E402
+    DAY_TYPE_CODES, DAY_NORMAL, ShiftInput, calculate_regular_hours, compute_minutes_batch, compute_work_hours,
+)
+
+GOLDEN_FILE = os.path.join(ROOT, 'scripts', 'golden', 'shift_engine_golden.json')
+CASE_COUNT = 2000
+SEED = 20251017
+
+HOLIDAY_TYPES = (None, 'normal', 'normal', 'weekend', 'vietnamese_holiday', 'japanese_holiday')
+SHIFT_CODES = ('1', '1', '2', '3', '4', '5', None)
+CUSTOM_SHIFTS = ((time(22, 0), time(6, 0)), (time(8, 30), time(17, 30)), (time(13, 0), time(13, 0)))
+COMP_CHOICES = (0, 0, 0, 15, 30, 60, 90)
+
+
+def generate_cases(count: int = CASE_COUNT, seed: int = SEED):
+    """Danh sách kwargs của ShiftInput - thứ tự và giá trị cố định theo seed"""
+    rng = random.Random(seed)
+    day = date(2025, 3, 10)
+    cases = []
+    for _ in range(count):
+        shift_code = rng.choice(SHIFT_CODES)
+        shift_start = shift_end = None
+        roll = rng.random()
+        if roll < 0.12:
+            shift_start, shift_end = rng.choice(CUSTOM_SHIFTS)
+        elif roll < 0.2 and shift_code:
+            shift_start = time(rng.choice((7, 8, 9)), rng.choice((0, 30)))
+
+        start_minute = rng.choice((rng.randrange(0, 23 * 60, 5), rng.randrange(6 * 60, 12 * 60, 5)))
+        check_in = datetime.combine(day, time()) + timedelta(minutes=start_minute)
+        check_out = check_in + timedelta(minutes=rng.choice((rng.randrange(5, 20 * 60, 5), rng.randrange(7 * 60, 11 * 60))))
+        if rng.random() < 0.1:
+            check_in += timedelta(seconds=rng.randrange(60))
+            check_out += timedelta(seconds=rng.randrange(60), microseconds=rng.choice((0, 500000)))
+        if rng.random() < 0.03:
+            check_in, check_out = rng.choice(((None, check_out), (check_in, None)))
+
+        break_time = rng.choice((0.0, 0.5, 1.0, 1.0, 1.5))
+        break_time_minutes = rng.choice((int(round(break_time * 60)),) * 4 + (0, None))
+        has_stored_minutes = rng.random() < 0.3
+        cases.append(dict(
+            date=day,
+            check_in=check_in,
+            check_out=check_out,
+            shift_code=shift_code,
+            shift_start=shift_start,
+            shift_end=shift_end,
+            holiday_type=rng.choice(HOLIDAY_TYPES),
+            break_time=break_time,
+            break_time_minutes=break_time_minutes,
+            comp_time_regular_minutes=rng.choice(COMP_CHOICES),
+            comp_time_overtime_minutes=rng.choice(COMP_CHOICES),
+            comp_time_ot_before_22_minutes=rng.choice(COMP_CHOICES),
+            comp_time_ot_after_22_minutes=rng.choice(COMP_CHOICES),
+            total_work_minutes=rng.randrange(300, 900) if has_stored_minutes else None,
+            regular_work_minutes=rng.randrange(0, 480) if has_stored_minutes else None,
+            total_work_hours=rng.choice((None, 7.5, 9.25)),
+            regular_work_hours=rng.choice((None, 6.0)),
+            required_hours=rng.choice((None, 8.0, 8.0, 6.0, 0)),
+            overtime_before_22=rng.choice((None, '1:15')),
+            overtime_after_22=rng.choice((None, '0:45')),
+            is_maternity_flex=rng.random() < 0.2,
+        ))
+    return cases
+
+
+def is_fixed_legacy_crash(case, legacy_output) -> bool:
+    """Cuối tuần / lễ Nhật không ca chuẩn: code cũ ném TypeError (time - time), bộ tính mới sửa"""
+    no_shift = case['shift_code'] not in ('1', '2', '3', '4', '5') and not (case['shift_start'] and case['shift_end'])
+    return (no_shift and case['holiday_type'] in ('weekend', 'japanese_holiday')
+            and case['check_in'] is not None and case['check_out'] is not None
+            and legacy_output[0] == '!TypeError')
+
+
+def _outcome(func):
+    try:
+        value = func()
+    except Exception as e:  # noqa: BLE001 - lỗi ném ra cũng là 1 phần của đầu ra
+        return f"!{type(e).__name__}"
+    return repr(value)
+
+
+def engine_outputs(case):
+    inp = ShiftInput(**case)
+    result = _outcome(lambda: tuple(compute_work_hours(inp)))
+    regular_before = _outcome(lambda: calculate_regular_hours(inp))
+
+    def regular_after():
+        res = compute_work_hours(inp)
+        return calculate_regular_hours(inp._replace(**res._asdict()))
+    return [result, regular_before, _outcome(regular_after)]
+
+
+# ---------------------------------------------------------------------------
+# Code cũ lấy từ git (chỉ dùng khi --legacy-rev)
+# ---------------------------------------------------------------------------
+
+def load_legacy_class(rev: str):
+    source = subprocess.run(['git', 'show', f'{rev}:database/models.py'], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    tree = ast.parse(source)
+    attendance = next(n for n in tree.body if isinstance(n, ast.ClassDef) and n.name == 'Attendance')
+    methods = [n for n in attendance.body if isinstance(n, ast.FunctionDef)
+               and n.name in ('update_work_hours', 'calculate_regular_work_hours')]
+    module = ast.Module(body=methods, type_ignores=[])
+    namespace = {'datetime': datetime, 'timedelta': timedelta, 'time': time, 'logging': logging}
+    exec(compile(module, f'{rev}:database/models.py', 'exec'), namespace)
+    # Logger cũ tự gắn FileHandler khi chưa có handler nào
+    logging.getLogger('attendance_logic').addHandler(logging.NullHandler())
+    return type('LegacyAttendance', (SimpleNamespace,), {
+        'update_work_hours': namespace['update_work_hours'],
+        'calculate_regular_work_hours': namespace['calculate_regular_work_hours'],
+    })
+
+
+def legacy_outputs(legacy_class, case):
+    fields = dict(case)
+    maternity = fields.pop('is_maternity_flex')
+    record = legacy_class(user=SimpleNamespace(is_maternity_flex=maternity), **fields)
+    regular_before = _outcome(record.calculate_regular_work_hours)
+
+    def update():
+        record.update_work_hours()
+        return (record.total_work_hours, record.regular_work_hours, record.overtime_before_22,
+                record.overtime_after_22, record.shift_start, record.shift_end)
+    result = _outcome(update)
+    regular_after = _outcome(record.calculate_regular_work_hours) if not result.startswith('!') else result
+    return [result, regular_before, regular_after]
+
+
+# ---------------------------------------------------------------------------
+# Lô số học phút nguyên so với từng bản ghi
+# ---------------------------------------------------------------------------
+
+def check_batch(cases):
+    rows = []
+    for case in cases:
+        ci, co = case['check_in'], case['check_out']
+        if not ci or not co or ci.second or co.second or co.microsecond or not case['shift_code']:
+            continue
+        if case['shift_start'] or case['shift_end']:
+            continue
+        if case['holiday_type'] == 'japanese_holiday' or case['break_time_minutes'] != int(round(case['break_time'] * 60)):
+            continue
+        rows.append(case)
+
+    day_start = datetime.combine(rows[0]['date'], time())
+    minutes = lambda dt: int((dt - day_start).total_seconds() // 60)  # noqa: E731
+    batch = compute_minutes_batch(
+        [minutes(c['check_in']) for c in rows],
+        [minutes(c['check_out']) for c in rows],
+        [c['shift_code'] for c in rows],
+        day_type=[DAY_TYPE_CODES.get(c['holiday_type'], DAY_NORMAL) for c in rows],
+        break_minutes=[c['break_time_minutes'] for c in rows],
+        comp_regular=[c['comp_time_regular_minutes'] for c in rows],
+        comp_overtime=[c['comp_time_overtime_minutes'] for c in rows],
+        comp_before_22=[c['comp_time_ot_before_22_minutes'] for c in rows],
+        comp_after_22=[c['comp_time_ot_after_22_minutes'] for c in rows],
+        maternity=[c['is_maternity_flex'] for c in rows],
+    )
+
+    def to_minutes(hhmm):
+        hours, mins = hhmm.split(':')
+        return int(hours) * 60 + int(mins)
+
+    failures, regular_rounding = [], 0
+    for i, case in enumerate(rows):
+        res = compute_work_hours(ShiftInput(**case))
+        expected = {
+            'work_minutes': int(round(res.total_work_hours * 60)),
+            'regular_minutes': int(round(res.regular_work_hours * 60)),
+            'ot_before_22': to_minutes(res.overtime_before_22),
+            'ot_after_22': to_minutes(res.overtime_after_22),
+        }
+        got = {key: int(batch[key][i]) for key in expected}
+        if got['regular_minutes'] != expected['regular_minutes']:
+            if abs(got['regular_minutes'] - expected['regular_minutes']) <= 1:
+                regular_rounding += 1
+                got['regular_minutes'] = expected['regular_minutes']
+        if got != expected:
+            failures.append((case, expected, got))
+    return len(rows), regular_rounding, failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--legacy-rev', help='So với Attendance cũ ở revision git này thay vì file golden')
+    parser.add_argument('--write', action='store_true', help='Ghi đầu ra của --legacy-rev vào file golden')
+    args = parser.parse_args()
+
+    cases = generate_cases()
+    if args.legacy_rev:
+        legacy_class = load_legacy_class(args.legacy_rev)
+        expected = [legacy_outputs(legacy_class, case) for case in cases]
+        overrides = [i for i, case in enumerate(cases) if is_fixed_legacy_crash(case, expected[i])]
+        for i in overrides:
+            expected[i] = engine_outputs(cases[i])
+        print(f"{len(overrides)} case cũ ném TypeError (không ca, cuối tuần / lễ Nhật) -> lấy đầu ra bộ tính mới")
+        if args.write:
+            os.makedirs(os.path.dirname(GOLDEN_FILE), exist_ok=True)
+            with open(GOLDEN_FILE, 'w', encoding='utf-8') as f:
+                json.dump({'seed': SEED, 'count': CASE_COUNT, 'source': args.legacy_rev,
+                           'engine_overrides': overrides, 'outputs': expected},
+                          f, ensure_ascii=False, separators=(',', ':'))
+                f.write('\n')
+            print(f"Đã ghi {len(expected)} đầu ra golden vào {os.path.relpath(GOLDEN_FILE, ROOT)}")
+    else:
+        with open(GOLDEN_FILE, encoding='utf-8') as f:
+            golden = json.load(f)
+        if golden['seed'] != SEED or golden['count'] != CASE_COUNT:
+            print("File golden được sinh với seed/count khác - sinh lại bằng --legacy-rev ... --write")
+            return 1
+        expected = golden['outputs']
+
+    mismatches = 0
+    for i, case in enumerate(cases):
+        got = engine_outputs(case)
+        if got != expected[i]:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"[{i}] {case}\n    cũ:  {expected[i]}\n    mới: {got}")
+    print(f"compute_work_hours / calculate_regular_hours: {len(cases) - mismatches}/{len(cases)} khớp")
+
+    checked, regular_rounding, failures = check_batch(cases)
+    for case, want, got in failures[:10]:
+        print(f"[batch] {case}\n    từng bản ghi: {want}\n    lô:           {got}")
+    print(f"compute_minutes_batch: {checked - len(failures)}/{checked} khớp "
+          f"({regular_rounding} lệch 1 phút giờ công do làm tròn 0.01h)")
+    return 1 if mismatches or failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2245,6 +2245,26 @@ async function handleBulkExport() {
     }
 }
 
+// Theo dõi tiến độ phê duyệt hàng loạt qua SSE (/sse/bulk-approval); trả về hàm đóng kết nối
+function watchBulkApprovalProgress(button) {
+    if (!window.EventSource || !button) {
+        return function () {};
+    }
+    const source = new EventSource('/sse/bulk-approval');
+    source.addEventListener('bulk_approval', function (event) {
+        try {
+            const data = JSON.parse(event.data);
+            if (data.total) {
+                const label = data.phase === 'google_sheet' ? 'Đang cập nhật Google Sheet' : 'Đang xử lý';
+                button.innerHTML = `<i class="fas fa-spinner fa-spin me-2"></i>${label} ${data.processed}/${data.total}...`;
+            }
+        } catch (e) {
+            console.warn('Bulk approval progress parse error:', e);
+        }
+    });
+    return function () { source.close(); };
+}
+
 // Function xử lý phê duyệt hàng loạt
 async function handleBulkApproval() {
     try {
@@ -2271,6 +2291,7 @@ async function handleBulkApproval() {
             btnBulkApprove.disabled = true;
             const originalText = btnBulkApprove.innerHTML;
             btnBulkApprove.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Đang xử lý...';
+            const stopProgress = watchBulkApprovalProgress(btnBulkApprove);
 
             try {
                 // Gọi API phê duyệt hàng loạt
@@ -2323,6 +2344,7 @@ async function handleBulkApproval() {
 
             } finally {
                 // Khôi phục trạng thái nút
+                stopProgress();
                 btnBulkApprove.disabled = false;
                 btnBulkApprove.innerHTML = originalText;
             }
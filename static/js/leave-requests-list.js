@@ -323,6 +323,20 @@ function bulkApproveLeaveRequests() {
     approveBtn.disabled = true;
     approveBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Dang xu ly...';
 
+    // Tien do tu /sse/bulk-approval (so don da xu ly / tong so)
+    var progressSource = window.EventSource ? new EventSource('/sse/bulk-approval') : null;
+    if (progressSource) {
+        progressSource.addEventListener('bulk_approval', function(event) {
+            var progress = JSON.parse(event.data);
+            if (progress.total) {
+                approveBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-2"></i>Dang xu ly ' + progress.processed + '/' + progress.total + '...';
+            }
+        });
+    }
+    function stopProgress() {
+        if (progressSource) progressSource.close();
+    }
+
     var ids = getPendingOfferIds();
 
     fetch('/api/leave/approve-all', {
@@ -338,6 +352,7 @@ function bulkApproveLeaveRequests() {
     })
         .then(function(response) { return response.json(); })
         .then(function(data) {
+            stopProgress();
             if (data.error) {
                 showNotificationModal('Loi', data.error, 'error');
                 approveBtn.disabled = false;
@@ -351,6 +366,7 @@ function bulkApproveLeaveRequests() {
         })
         .catch(function(error) {
             console.error('Error:', error);
+            stopProgress();
             showNotificationModal('Loi', 'Co loi xay ra khi phe duyet hang loat!', 'error');
             approveBtn.disabled = false;
             approveBtn.innerHTML = '<i class="fas fa-check me-2"></i>Phe duyet';
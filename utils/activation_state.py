@@ -0,0 +1,123 @@
+"""
+Trạng thái kích hoạt / license key giữ trong process
+
+Trước đây index(), login(), chatbot... gọi is_app_activated() -> get_activation_record()
+ở mỗi request (1 query SQLite, có thể retry + sleep tới 3s khi DB bị lock),
+và get_license_key() cũng đọc bảng Activation mỗi vòng kiểm tra license.
+
+Giờ bảng Activation chỉ được đọc khi:
+    - lần đầu cần tới trạng thái
+    - có thay đổi: /activate, /api/activate, /api/license/update-db-key gọi update()/invalidate()
+    - thread kiểm tra license làm mới mỗi vòng (đồng bộ thay đổi từ worker khác / script ngoài)
+    - quá ACTIVATION_STATE_TTL giây kể từ lần nạp gần nhất (lưới an toàn)
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ACTIVATION_STATE_TTL = int(os.environ.get('ACTIVATION_STATE_TTL', 300))
+
+
+@dataclass(frozen=True)
+class ActivationSnapshot:
+    """Bản sao chỉ đọc của bản ghi Activation (không giữ ORM object giữa các request)"""
+    is_activated: bool
+    license_key: Optional[str]
+    activated_at: Optional[datetime]
+
+    @classmethod
+    def from_record(cls, activation) -> 'ActivationSnapshot':
+        if activation is None:
+            return cls(False, None, None)
+        return cls(bool(activation.is_activated), activation.license_key, activation.activated_at)
+
+
+class ActivationState:
+    """Cache trạng thái kích hoạt, thread-safe, có thống kê số lần nạp lại"""
+
+    def __init__(self, ttl_seconds: int = ACTIVATION_STATE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._snapshot: Optional[ActivationSnapshot] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._refreshes = {}  # lý do -> số lần
+        self._load_errors = 0
+        self._last_refresh_reason = None
+        self._last_refresh_at = None
+        self._pending_reason = None
+
+    def get(self, loader: Callable[[], ActivationSnapshot]) -> ActivationSnapshot:
+        """Trả về snapshot hiện tại; chỉ gọi loader (đọc DB) khi chưa có, đã bị invalidate hoặc quá TTL"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            self._hits += 1
+            return snapshot
+        reason = self._pending_reason or ('initial' if snapshot is None else 'expired')
+        return self.refresh(loader, reason=reason)
+
+    def refresh(self, loader: Callable[[], ActivationSnapshot], reason: str = 'manual') -> ActivationSnapshot:
+        """
+        Đọc lại từ DB. Lỗi (vd: database locked quá số lần retry) -> giữ snapshot cũ nếu có;
+        chưa có snapshot thì ném lỗi cho caller như trước.
+        """
+        with self._lock:
+            try:
+                snapshot = loader()
+            except Exception as e:
+                self._load_errors += 1
+                if self._snapshot is None:
+                    raise
+                logger.warning(f"Không nạp lại được trạng thái kích hoạt ({reason}): {e}. Dùng trạng thái cũ")
+                # Không để request kế tiếp lại retry/sleep ngay; thread license sẽ thử lại ở vòng sau
+                self._loaded_at = time.monotonic()
+                return self._snapshot
+            self._store(snapshot, reason)
+            return snapshot
+
+    def update(self, activation, reason: str) -> None:
+        """Gọi ngay sau khi commit thay đổi bản ghi Activation trong process này"""
+        with self._lock:
+            self._store(ActivationSnapshot.from_record(activation), reason)
+
+    def invalidate(self, reason: str = 'invalidate') -> None:
+        """Buộc lần get() sau đọc lại từ DB"""
+        with self._lock:
+            self._loaded_at = 0.0
+            self._pending_reason = reason
+
+    def _store(self, snapshot: ActivationSnapshot, reason: str) -> None:
+        changed = self._snapshot is not None and snapshot != self._snapshot
+        self._snapshot = snapshot
+        self._loaded_at = time.monotonic()
+        self._refreshes[reason] = self._refreshes.get(reason, 0) + 1
+        self._last_refresh_reason = reason
+        self._last_refresh_at = datetime.now()
+        self._pending_reason = None
+        if changed:
+            logger.info(f"Trạng thái kích hoạt thay đổi ({reason}): is_activated={snapshot.is_activated}")
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'is_activated': snapshot.is_activated if snapshot else None,
+            'has_db_key': bool(snapshot and snapshot.license_key),
+            'hits': self._hits,
+            'refreshes': dict(self._refreshes),
+            'refresh_total': sum(self._refreshes.values()),
+            'load_errors': self._load_errors,
+            'last_refresh_reason': self._last_refresh_reason,
+            'last_refresh_at': self._last_refresh_at.isoformat() if self._last_refresh_at else None,
+            'age_seconds': round(time.monotonic() - self._loaded_at, 1) if snapshot and self._loaded_at else None,
+            'ttl_seconds': self.ttl_seconds,
+        }
+
+
+# Global instance - dùng chung cho before_request, login và thread kiểm tra license
+activation_state = ActivationState()
@@ -0,0 +1,204 @@
+"""
+Phê duyệt hàng loạt theo lô (approve_all_attendances / approve_all_leave_requests)
+
+Trước đây 2 route nạp toàn bộ bản ghi bằng .all(), sửa từng object rồi ghi 1 AuditLog
+(1 commit) cho MỖI bản ghi -> backlog cuối tháng vài nghìn dòng giữ worker nhiều phút.
+
+    - Đọc theo lô keyset (id > id cuối của lô trước), commit sau mỗi lô nên không giữ
+      khoá ghi SQLite suốt cả quá trình (yield_per không dùng được vì commit đóng cursor)
+    - Cập nhật status/người duyệt/chữ ký/version bằng 1 câu UPDATE ... WHERE id IN (...)
+      cho cả lô; điều kiện status cũ nằm trong WHERE nên bản ghi vừa bị người khác xử lý bị bỏ qua
+    - 1 AuditLog gộp cho mỗi lô (danh sách id + số lượng)
+    - Tiến độ publish lên sse_broker (kênh bulk_approval:<user_id>) cho /sse/bulk-approval
+"""
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import case, literal, update
+
+from database.models import db, Attendance
+from utils.session import log_audit_action
+
+logger = logging.getLogger(__name__)
+
+BULK_APPROVAL_CHUNK_SIZE = int(os.environ.get('BULK_APPROVAL_CHUNK_SIZE', 500))
+
+# Trạng thái chờ duyệt mà từng role được xử lý (giống bộ lọc cũ của 2 route)
+ATTENDANCE_PENDING_STATUSES = {
+    'TEAM_LEADER': ('pending',),
+    'MANAGER': ('pending', 'pending_manager'),
+    'ADMIN': ('pending', 'pending_manager', 'pending_admin'),
+}
+LEAVE_PENDING_STATUSES = {
+    'TEAM_LEADER': ('pending',),
+    'MANAGER': ('pending_manager',),
+    'ADMIN': ('pending_admin',),
+}
+
+
+def bulk_approval_channel(user_id: int) -> str:
+    return f"bulk_approval:{user_id}"
+
+
+def chunked(items: Sequence, size: int = BULK_APPROVAL_CHUNK_SIZE) -> Iterator[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def iter_keyset_chunks(query, id_column, chunk_size: int = BULK_APPROVAL_CHUNK_SIZE) -> Iterator[List]:
+    """
+    Duyệt query theo lô chunk_size bản ghi, sắp theo id tăng dần (id > id cuối lô trước).
+    An toàn khi commit / UPDATE giữa các lô, kể cả khi UPDATE làm bản ghi rời khỏi bộ lọc.
+    """
+    last_id = 0
+    while True:
+        rows = query.filter(id_column > last_id).order_by(id_column.asc()).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+
+def bulk_update(model, ids: Sequence[int], values: Dict, *guards) -> int:
+    """UPDATE model SET values WHERE id IN ids AND guards; trả về số dòng đổi (chưa commit)"""
+    if not ids:
+        return 0
+    stmt = (
+        update(model)
+        .where(model.id.in_(list(ids)), *guards)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(stmt).rowcount or 0
+
+
+def log_bulk_audit(user_id: int, action: str, table_name: str, ids: Sequence[int],
+                   old_statuses: Iterable[str], new_values: Dict) -> None:
+    """1 bản ghi AuditLog cho cả lô thay vì 1 bản ghi (và 1 commit) cho mỗi id"""
+    if not ids:
+        return
+    log_audit_action(
+        user_id=user_id,
+        action=action,
+        table_name=table_name,
+        record_id=None,
+        old_values={'status': sorted(set(old_statuses))},
+        new_values=dict(new_values, ids=list(ids), count=len(ids)),
+    )
+
+
+def _when_status(column, statuses: Sequence[str], value, else_):
+    return case((column.in_(list(statuses)), literal(value)), else_=else_)
+
+
+# ---------------------------------------------------------------------------
+# Giá trị UPDATE theo role (giữ đúng quy tắc ký / chuyển bước của vòng lặp cũ)
+# ---------------------------------------------------------------------------
+
+def attendance_step_values(role: str, approver_id: int, signature: Optional[str], now: datetime) -> Dict:
+    """TEAM_LEADER / MANAGER duyệt: chuyển bản ghi lên bước kế tiếp"""
+    values = {'approved_by': approver_id, 'approved_at': now}
+    if role == 'TEAM_LEADER':
+        values.update(status='pending_manager', team_leader_signer_id=approver_id)
+        if signature:
+            values['team_leader_signature'] = signature
+    else:  # MANAGER
+        values.update(status='pending_admin', manager_signer_id=approver_id)
+        if signature:
+            # Bản ghi còn 'pending' (chưa qua trưởng nhóm) -> manager ký luôn vị trí trưởng nhóm
+            values['team_leader_signature'] = _when_status(
+                Attendance.status, ('pending',), signature, Attendance.team_leader_signature)
+            values['team_leader_signer_id'] = case(
+                ((Attendance.status == 'pending') & Attendance.team_leader_signer_id.is_(None), literal(approver_id)),
+                else_=Attendance.team_leader_signer_id)
+            values['manager_signature'] = signature
+    return values
+
+
+def attendance_final_values(approver_id: int, signature: Optional[str], now: datetime) -> Dict:
+    """ADMIN duyệt (sau khi Google Sheet cập nhật thành công)"""
+    values = {
+        'status': 'approved',
+        'approved': True,
+        'approved_by': approver_id,
+        'approved_at': now,
+        'version': Attendance.version + 1,
+    }
+    if signature:
+        values['team_leader_signature'] = _when_status(
+            Attendance.status, ('pending',), signature, Attendance.team_leader_signature)
+        values['team_leader_signer_id'] = _when_status(
+            Attendance.status, ('pending',), approver_id, Attendance.team_leader_signer_id)
+        values['manager_signature'] = _when_status(
+            Attendance.status, ('pending_manager', 'pending_admin'), signature, Attendance.manager_signature)
+        values['manager_signer_id'] = _when_status(
+            Attendance.status, ('pending_manager', 'pending_admin'), approver_id, Attendance.manager_signer_id)
+    return values
+
+
+def attendance_reject_values(approver_id: int, reason: str, now: datetime) -> Dict:
+    return {'status': 'rejected', 'reject_reason': reason, 'approved_by': approver_id, 'approved_at': now}
+
+
+def leave_step_values(role: str, approver_id: int, signature: Optional[str], now: datetime) -> Dict:
+    """TEAM_LEADER / MANAGER duyệt đơn nghỉ: chuyển sang bước kế tiếp"""
+    if role == 'TEAM_LEADER':
+        values = {'status': 'pending_manager', 'step': 'manager', 'current_approver_id': None}
+        if signature:
+            values.update(team_leader_signature=signature, team_leader_signer_id=approver_id,
+                          team_leader_approved_at=now)
+    else:  # MANAGER
+        values = {'status': 'pending_admin', 'step': 'admin', 'current_approver_id': None}
+        if signature:
+            values.update(manager_signature=signature, manager_signer_id=approver_id, manager_approved_at=now)
+    return values
+
+
+def leave_final_values(approver_id: int, signature: Optional[str], now: datetime) -> Dict:
+    """ADMIN duyệt đơn nghỉ (sau khi Google Sheet cập nhật thành công)"""
+    values = {
+        'status': 'approved',
+        'step': 'done',
+        'current_approver_id': None,
+        'google_sheet_synced': True,
+        'google_sheet_sync_at': now,
+        'google_sheet_sync_error': None,
+    }
+    if signature:
+        values.update(admin_signature=signature, admin_signer_id=approver_id, admin_approved_at=now)
+    return values
+
+
+def leave_reject_values(reason: str) -> Dict:
+    return {'status': 'rejected', 'reject_reason': reason, 'step': 'done', 'current_approver_id': None}
+
+
+class BulkApprovalProgress:
+    """Đếm tiến độ và publish lên sse_broker; lỗi publish không làm hỏng quá trình duyệt"""
+
+    def __init__(self, user_id: int, kind: str, total: int):
+        self.channel = bulk_approval_channel(user_id)
+        self.kind = kind
+        self.total = total
+        self.processed = 0
+
+    def publish(self, phase: str, **extra) -> None:
+        from utils.sse_broker import sse_broker
+
+        payload = dict(kind=self.kind, phase=phase, processed=self.processed, total=self.total, **extra)
+        try:
+            sse_broker.publish(self.channel, payload)
+        except Exception as e:
+            logger.warning(f"Không publish được tiến độ phê duyệt hàng loạt: {e}")
+
+    def advance(self, count: int, phase: str) -> None:
+        self.processed = min(self.total, self.processed + count)
+        self.publish(phase)
+
+    def done(self, **summary) -> None:
+        self.processed = self.total
+        self.publish('done', **summary)
@@ -3,41 +3,43 @@ Decorators for the attendance management system
 """
 from functools import wraps
 from flask import request, jsonify, current_app
-from collections import defaultdict
-import time as time_module
 import logging
 
-logger = logging.getLogger(__name__)
+from utils.rate_limiter import rate_limiter
 
-# Fallback in-memory storage (for development)
-rate_limit_storage = defaultdict(list)
+logger = logging.getLogger(__name__)
 
-def rate_limit(max_requests=10, window_seconds=60):
-    """Rate limiting decorator with in-memory storage"""
+def rate_limit(max_requests=10, window_seconds=60, per_endpoint=False):
+    """
+    Rate limiting decorator (sliding window) theo IP: các endpoint dùng chung 1 hạn mức cho mỗi IP
+    (các endpoint khác độ dài cửa sổ có bộ đếm riêng). per_endpoint=True: hạn mức riêng cho từng endpoint.
+    Storage lấy từ RATELIMIT_STORAGE_URL (memory:// | redis://... | sqlite:///...) để dùng chung giữa các worker.
+    """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
+            if not current_app.config.get('RATELIMIT_ENABLED', True):
+                return f(*args, **kwargs)
+
             # Get client IP
             client_ip = request.remote_addr
-            current_time = time_module.time()
-            
-            # Clean up old entries
-            cutoff_time = current_time - window_seconds
-            rate_limit_storage[client_ip] = [
-                timestamp for timestamp in rate_limit_storage[client_ip]
-                if timestamp > cutoff_time
-            ]
-            
-            # Check if limit exceeded
-            if len(rate_limit_storage[client_ip]) >= max_requests:
-                logger.warning(f"Rate limit exceeded for IP {client_ip}")
-                return jsonify({'error': 'Quá nhiều yêu cầu. Vui lòng thử lại sau.'}), 429
-            
-            # Add current request
-            rate_limit_storage[client_ip].append(current_time)
-            
+            # Bộ đếm cửa sổ cố định chỉ đúng khi mọi lần hit cùng key có cùng window_seconds
+            key = f"{client_ip}:{window_seconds}"
+            if per_endpoint:
+                key = f"{f.__module__}.{f.__name__}:{key}"
+
+            allowed, retry_after = rate_limiter.hit(
+                key, max_requests, window_seconds,
+                storage_url=current_app.config.get('RATELIMIT_STORAGE_URL')
+            )
+            if not allowed:
+                logger.warning(f"Rate limit exceeded for IP {client_ip} on {f.__name__}")
+                response = jsonify({'error': 'Quá nhiều yêu cầu. Vui lòng thử lại sau.'})
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+
             # Execute function
             return f(*args, **kwargs)
-                
+
         return decorated_function
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,171 @@
+"""
+Cache metadata Google Drive/Sheets dùng chung cho toàn process
+
+Mọi instance GoogleDriveAPI đều đọc/ghi vào cùng một cache:
+    - (team, month) -> file timesheet (id, name, ...)   -> tránh _find_month_folder/_search_timesheet_in_folder
+    - spreadsheet_id -> {sheet title: sheetId}            -> tránh spreadsheets().get
+Có TTL, invalidation thủ công, bộ đếm hit/miss và tuỳ chọn lưu ra đĩa (JSON).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMESHEET_TTL = int(os.environ.get('GOOGLE_TIMESHEET_CACHE_TTL', 6 * 3600))  # 6 giờ
+DEFAULT_SHEET_MAP_TTL = int(os.environ.get('GOOGLE_SHEET_MAP_CACHE_TTL', 3600))  # 1 giờ
+# Để trống = chỉ cache trong bộ nhớ
+DEFAULT_PERSIST_PATH = os.environ.get('GOOGLE_METADATA_CACHE_FILE', '')
+
+
+class DriveMetadataCache:
+    """Cache metadata Drive/Sheets thread-safe với TTL và thống kê hit/miss"""
+
+    TIMESHEET = 'timesheet'
+    SHEET_MAP = 'sheet_map'
+
+    def __init__(self, timesheet_ttl=DEFAULT_TIMESHEET_TTL, sheet_map_ttl=DEFAULT_SHEET_MAP_TTL,
+                 persist_path=DEFAULT_PERSIST_PATH):
+        self.timesheet_ttl = timesheet_ttl
+        self.sheet_map_ttl = sheet_map_ttl
+        self.persist_path = persist_path or None
+        self._lock = threading.RLock()
+        # namespace -> key -> (expires_at, value)
+        self._entries: Dict[str, Dict[str, tuple]] = {self.TIMESHEET: {}, self.SHEET_MAP: {}}
+        self._stats = {
+            self.TIMESHEET: {'hits': 0, 'misses': 0},
+            self.SHEET_MAP: {'hits': 0, 'misses': 0},
+        }
+        self._load_from_disk()
+
+    # ------------------------------------------------------------------ #
+    # Truy cập chung
+    # ------------------------------------------------------------------ #
+    def _get(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries[namespace].get(key)
+            if entry is not None and entry[0] > now:
+                self._stats[namespace]['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[namespace][key]  # Hết hạn
+            self._stats[namespace]['misses'] += 1
+            return None
+
+    def _set(self, namespace: str, key: str, value: Any, ttl: int) -> None:
+        with self._lock:
+            self._entries[namespace][key] = (time.time() + ttl, value)
+            self._save_to_disk()
+
+    @staticmethod
+    def _timesheet_key(team: str, month_year: str) -> str:
+        return f"{team}_{month_year}"
+
+    # ------------------------------------------------------------------ #
+    # (team, month) -> timesheet file
+    # ------------------------------------------------------------------ #
+    def get_timesheet(self, team: str, month_year: str) -> Optional[dict]:
+        return self._get(self.TIMESHEET, self._timesheet_key(team, month_year))
+
+    def set_timesheet(self, team: str, month_year: str, file_info: dict) -> None:
+        if not file_info or not file_info.get('id'):
+            return
+        self._set(self.TIMESHEET, self._timesheet_key(team, month_year), dict(file_info), self.timesheet_ttl)
+
+    def invalidate_timesheet(self, team: Optional[str] = None, month_year: Optional[str] = None,
+                             spreadsheet_id: Optional[str] = None) -> int:
+        """Xoá mapping timesheet theo team/tháng hoặc theo spreadsheet_id. Trả về số entry đã xoá."""
+        with self._lock:
+            entries = self._entries[self.TIMESHEET]
+            if team is not None and month_year is not None:
+                keys = [self._timesheet_key(team, month_year)]
+            else:
+                keys = []
+                for key, (_, value) in entries.items():
+                    if team is not None and not key.startswith(f"{team}_"):
+                        continue
+                    if month_year is not None and not key.endswith(f"_{month_year}"):
+                        continue
+                    if spreadsheet_id is not None and value.get('id') != spreadsheet_id:
+                        continue
+                    keys.append(key)
+            removed = sum(1 for key in keys if entries.pop(key, None) is not None)
+            if removed:
+                self._save_to_disk()
+            return removed
+
+    # ------------------------------------------------------------------ #
+    # spreadsheet_id -> {title: sheetId}
+    # ------------------------------------------------------------------ #
+    def get_sheet_map(self, spreadsheet_id: str) -> Optional[Dict[str, int]]:
+        return self._get(self.SHEET_MAP, spreadsheet_id)
+
+    def set_sheet_map(self, spreadsheet_id: str, sheet_map: Dict[str, int]) -> None:
+        self._set(self.SHEET_MAP, spreadsheet_id, dict(sheet_map), self.sheet_map_ttl)
+
+    def invalidate_spreadsheet(self, spreadsheet_id: str) -> None:
+        """Xoá danh sách sheet của spreadsheet (vd: khi sheet mới được tạo hoặc bị đổi tên)"""
+        with self._lock:
+            if self._entries[self.SHEET_MAP].pop(spreadsheet_id, None) is not None:
+                self._save_to_disk()
+
+    def clear(self) -> None:
+        with self._lock:
+            for entries in self._entries.values():
+                entries.clear()
+            self._save_to_disk()
+
+    def stats(self) -> dict:
+        """Thống kê hit/miss; mỗi hit là ít nhất 1 lần gọi Drive/Sheets API được tiết kiệm"""
+        with self._lock:
+            result = {}
+            for namespace, counters in self._stats.items():
+                total = counters['hits'] + counters['misses']
+                result[namespace] = {
+                    'hits': counters['hits'],
+                    'misses': counters['misses'],
+                    'hit_rate': round(counters['hits'] / total, 3) if total else 0.0,
+                    'entries': len(self._entries[namespace]),
+                }
+            result['persist_path'] = self.persist_path
+            return result
+
+    # ------------------------------------------------------------------ #
+    # Lưu/đọc đĩa (tuỳ chọn)
+    # ------------------------------------------------------------------ #
+    def _save_to_disk(self) -> None:
+        if not self.persist_path:
+            return
+        try:
+            directory = os.path.dirname(self.persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            data = {ns: {k: [exp, v] for k, (exp, v) in entries.items()} for ns, entries in self._entries.items()}
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            logger.warning(f"Không thể lưu Google metadata cache: {e}")
+
+    def _load_from_disk(self) -> None:
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            for namespace in self._entries:
+                for key, (expires_at, value) in (data.get(namespace) or {}).items():
+                    if expires_at > now:
+                        self._entries[namespace][key] = (expires_at, value)
+        except Exception as e:
+            logger.warning(f"Không thể đọc Google metadata cache từ đĩa: {e}")
+
+
+# Global instance - dùng chung cho mọi GoogleDriveAPI
+drive_metadata_cache = DriveMetadataCache()
@@ -0,0 +1,462 @@
+"""
+Outbox email bền vững (bảng email_outbox) + 1 worker gửi qua kết nối SMTP dùng lại
+
+Trước đây send_leave_request_email_async tạo 1 thread cho mỗi email, mỗi email lại mở kết nối
+SMTP mới (TCP + STARTTLS + login); send_reset_email cũng vậy và chặn request. Trạng thái gửi
+đi qua db_update_queue, chỉ được xử lý khi có người mở /dashboard (process_db_updates).
+
+    - enqueue ghi email đã dựng sẵn (MIME) vào DB, commit ngay -> restart không mất email đang chờ
+    - 1 worker thread / process lấy các email đến hạn theo lô, gửi lần lượt trên cùng 1 kết nối
+      SMTP đã STARTTLS + login; kết nối đóng khi rảnh quá SMTP_IDLE_SECONDS hoặc đã gửi
+      SMTP_MAX_MESSAGES_PER_CONNECTION email, server tự ngắt thì mở lại và gửi lại 1 lần
+    - Lỗi tạm thời (4xx, mất kết nối, sai cấu hình / đăng nhập) -> backoff luỹ thừa + jitter qua
+      next_retry_at, quá EMAIL_OUTBOX_MAX_ATTEMPTS lần -> 'failed'; lỗi 5xx (địa chỉ sai...) -> 'failed' ngay
+    - Trạng thái (sending / success / error) của email gắn với đơn nghỉ được ghi qua on_status
+      và publish thẳng lên sse_broker (kênh email:<user_id>) ngay khi worker gửi xong
+    - Dòng 'sending' quá EMAIL_OUTBOX_LEASE_SECONDS (worker chết giữa chừng) -> trả về 'pending'
+      (kết quả mỗi email commit ngay sau khi gửi, các email chưa gửi trong lô được gia hạn lease)
+"""
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import Message
+from typing import Callable, Iterable, List, Optional, Union
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models import db, EmailOutboxMessage
+
+logger = logging.getLogger(__name__)
+
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 20))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', 5.0))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 6))
+EMAIL_OUTBOX_BACKOFF_BASE = float(os.environ.get('EMAIL_OUTBOX_BACKOFF_BASE', 30))
+EMAIL_OUTBOX_BACKOFF_MAX = float(os.environ.get('EMAIL_OUTBOX_BACKOFF_MAX', 1800))
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.environ.get('EMAIL_OUTBOX_LEASE_SECONDS', 300))
+EMAIL_OUTBOX_SENT_RETENTION_DAYS = int(os.environ.get('EMAIL_OUTBOX_SENT_RETENTION_DAYS', 7))
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', 30))
+# Đóng kết nối khi rảnh quá chừng này giây (nhiều server tự ngắt kết nối rảnh sau 1-5 phút)
+SMTP_IDLE_SECONDS = float(os.environ.get('SMTP_IDLE_SECONDS', 60))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION', 100))
+# 0: không STARTTLS (chỉ dùng cho server thử nghiệm cục bộ)
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+
+STATE_PENDING = 'pending'
+STATE_SENDING = 'sending'
+STATE_SENT = 'sent'
+STATE_FAILED = 'failed'
+
+KIND_LEAVE_REQUEST = 'leave_request'
+KIND_PASSWORD_RESET = 'password_reset'
+
+# Trạng thái hiển thị trên UI (EmailStatusRecord / SSE)
+STATUS_SENDING = 'sending'
+STATUS_SUCCESS = 'success'
+STATUS_ERROR = 'error'
+
+
+def email_status_channel(user_id: int) -> str:
+    """Kênh sse_broker của /sse/email-status"""
+    return f"email:{user_id}"
+
+
+def smtp_settings() -> dict:
+    """Đọc cấu hình SMTP mỗi lần mở kết nối (sửa .env + restart không cần đổi code)"""
+    return {
+        'server': os.getenv('SMTP_SERVER'),
+        'port': int(os.getenv('SMTP_PORT', '587')),
+        'user': os.getenv('SMTP_USER'),
+        'password': os.getenv('SMTP_PASSWORD'),
+    }
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Backoff luỹ thừa theo số lần thử, jitter 50-100% để các email không dồn cùng lúc"""
+    delay = min(EMAIL_OUTBOX_BACKOFF_BASE * (2 ** max(0, attempts - 1)), EMAIL_OUTBOX_BACKOFF_MAX)
+    return delay * (0.5 + random.random() / 2)
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """55x cho đúng email này (người nhận / người gửi / nội dung bị từ chối) -> không thử lại.
+    50x (sai trình tự lệnh), 530 (chưa đăng nhập)... là lỗi của phiên SMTP -> mở kết nối mới và thử lại"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(550 <= code < 560 for code in codes)
+    if isinstance(error, (smtplib.SMTPSenderRefused, smtplib.SMTPDataError)):
+        return 550 <= error.smtp_code < 560
+    return False
+
+
+class SMTPConfigError(Exception):
+    """Thiếu cấu hình SMTP"""
+
+
+class SMTPConnection:
+    """1 kết nối SMTP đã STARTTLS + login, dùng lại cho nhiều email (chỉ thread worker dùng)"""
+
+    def __init__(self, idle_seconds: float = SMTP_IDLE_SECONDS,
+                 max_messages: int = SMTP_MAX_MESSAGES_PER_CONNECTION):
+        self.idle_seconds = idle_seconds
+        self.max_messages = max_messages
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._sent_on_connection = 0
+        self.connects = 0
+        self.reconnects = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._smtp is not None
+
+    def _open(self) -> None:
+        settings = smtp_settings()
+        if not settings['server']:
+            raise SMTPConfigError('Thiếu SMTP_SERVER')
+        if settings['port'] == 465:
+            smtp = smtplib.SMTP_SSL(settings['server'], settings['port'], timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(settings['server'], settings['port'], timeout=SMTP_TIMEOUT)
+        try:
+            smtp.ehlo()
+            if SMTP_STARTTLS and settings['port'] != 465:
+                smtp.starttls()
+                smtp.ehlo()
+            if settings['user'] and settings['password']:
+                smtp.login(settings['user'], settings['password'])
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._sent_on_connection = 0
+        self._last_used = time.monotonic()
+        self.connects += 1
+        logger.debug("Đã mở kết nối SMTP %s:%s", settings['server'], settings['port'])
+
+    def send(self, sender: str, recipients: List[str], message: str) -> dict:
+        """Gửi 1 email; trả về các người nhận bị từ chối (nếu chỉ 1 phần bị từ chối)"""
+        if self._smtp is not None and (time.monotonic() - self._last_used > self.idle_seconds
+                                       or self._sent_on_connection >= self.max_messages):
+            self.close()
+        if self._smtp is None:
+            self._open()
+        try:
+            refused = self._smtp.sendmail(sender, recipients, message.encode('utf-8'))
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Server đã đóng kết nối (idle timeout...) -> mở lại và gửi lại 1 lần
+            self.close()
+            self._open()
+            self.reconnects += 1
+            refused = self._smtp.sendmail(sender, recipients, message.encode('utf-8'))
+        self._last_used = time.monotonic()
+        self._sent_on_connection += 1
+        return refused
+
+    def close_if_idle(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_seconds:
+            self.close()
+
+    def close(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+
+class EmailOutbox:
+    """Ghi email vào outbox + worker thread gửi theo lô trên 1 kết nối SMTP"""
+
+    def __init__(self):
+        self._app = None
+        self._engine = None
+        self._on_status: Optional[Callable[[int, str, str], None]] = None
+        self._connection = SMTPConnection()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        # Kết nối SMTP chỉ dùng bởi 1 thread tại 1 thời điểm (worker / gọi run_once trực tiếp)
+        self._send_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'batches': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'recovered': 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        # Tăng từ thread request (enqueue) lẫn worker thread -> cần khoá
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def init_app(self, app, on_status: Optional[Callable[[int, str, str], None]] = None) -> None:
+        """on_status(request_id, status, message): lưu trạng thái email của đơn (upsert_email_status)"""
+        self._app = app
+        self._on_status = on_status
+        with app.app_context():
+            self._engine = db.engine
+
+    def _session(self) -> Session:
+        # Session riêng: không commit hộ transaction đang dở của request gọi enqueue
+        return Session(bind=self._engine, autoflush=False, expire_on_commit=False)
+
+    # ------------------------------------------------------------------
+    # Trạng thái
+    # ------------------------------------------------------------------
+
+    def publish_status(self, request_id: Optional[int], user_id: Optional[int], status: str, message: str) -> None:
+        """Lưu trạng thái (on_status) và đẩy thẳng lên SSE; lỗi ở đây không ảnh hưởng việc gửi"""
+        if request_id is None:
+            return
+        if self._on_status is not None:
+            try:
+                with self._app.app_context():
+                    self._on_status(request_id, status, message)
+            except Exception as e:
+                logger.warning(f"Không lưu được trạng thái email #{request_id}: {e}")
+        if user_id is not None:
+            from utils.sse_broker import sse_broker
+
+            try:
+                sse_broker.publish(email_status_channel(user_id),
+                                   {'request_id': request_id, 'status': status, 'message': message})
+            except Exception as e:
+                logger.warning(f"Không publish được trạng thái email #{request_id}: {e}")
+
+    # ------------------------------------------------------------------
+    # Ghi việc
+    # ------------------------------------------------------------------
+
+    def enqueue(self, message: Union[Message, str], sender: str, recipients: Iterable[str], kind: str,
+                request_id: Optional[int] = None, user_id: Optional[int] = None,
+                status_message: str = 'Đang gửi email thông báo...') -> int:
+        """Thêm 1 email đã dựng sẵn vào outbox; trả về id dòng outbox"""
+        if self._engine is None:
+            raise RuntimeError('EmailOutbox chưa init_app()')
+        recipients = [r for r in recipients if r]
+        if not recipients:
+            raise ValueError('Email không có người nhận')
+        subject = message.get('Subject') if isinstance(message, Message) else None
+        raw = message.as_string() if isinstance(message, Message) else message
+
+        # 'sending' ghi trước khi worker có thể gửi xong -> không đè lên kết quả cuối;
+        # INSERT lỗi thì ghi 'error' để giao diện không kẹt ở "đang gửi"
+        self.publish_status(request_id, user_id, STATUS_SENDING, status_message)
+        try:
+            with self._session() as session:
+                row = EmailOutboxMessage(
+                    kind=kind, request_id=request_id, user_id=user_id, sender=sender, recipients=recipients,
+                    subject=str(subject)[:500] if subject is not None else None, message=raw,
+                    state=STATE_PENDING, attempts=0, next_retry_at=datetime.utcnow(),
+                )
+                session.add(row)
+                session.commit()
+                row_id = row.id
+        except Exception:
+            self.publish_status(request_id, user_id, STATUS_ERROR, 'Không thể gửi email')
+            raise
+        self._count('enqueued')
+
+        self.start()
+        self._wake.set()
+        return row_id
+
+    def retry_failed(self) -> int:
+        """Đưa các email 'failed' về 'pending'"""
+        with self._session() as session:
+            count = (session.query(EmailOutboxMessage)
+                     .filter(EmailOutboxMessage.state == STATE_FAILED)
+                     .update({'state': STATE_PENDING, 'attempts': 0, 'next_retry_at': datetime.utcnow()},
+                             synchronize_session=False))
+            session.commit()
+        if count:
+            self.start()
+            self._wake.set()
+        return count
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._engine is None:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+            self._thread.start()
+        logger.info("Đã khởi động worker outbox email")
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(EMAIL_OUTBOX_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                if self.run_once():
+                    # Còn email đến hạn -> gửi tiếp ngay trên kết nối đang mở
+                    self._wake.set()
+                else:
+                    with self._send_lock:
+                        self._connection.close_if_idle()
+            except Exception as e:
+                logger.error(f"Lỗi worker outbox email: {e}", exc_info=True)
+                with self._send_lock:
+                    self._connection.close()
+                time.sleep(1)
+
+    def run_once(self) -> bool:
+        """1 vòng: thu hồi lease hết hạn, lấy tối đa 1 lô email đến hạn và gửi; trả về đã gửi được email nào chưa"""
+        with self._send_lock:
+            return self._run_once()
+
+    def _run_once(self) -> bool:
+        now = datetime.utcnow()
+        with self._session() as session:
+            recovered = (session.query(EmailOutboxMessage)
+                         .filter(EmailOutboxMessage.state == STATE_SENDING,
+                                 EmailOutboxMessage.updated_at < now - timedelta(seconds=EMAIL_OUTBOX_LEASE_SECONDS))
+                         .update({'state': STATE_PENDING, 'updated_at': now}, synchronize_session=False))
+            self._count('recovered', recovered or 0)
+            self._purge_sent(session)
+            session.commit()
+
+            due = [row_id for (row_id,) in session.query(EmailOutboxMessage.id)
+                   .filter(EmailOutboxMessage.state == STATE_PENDING, EmailOutboxMessage.next_retry_at <= now)
+                   .order_by(EmailOutboxMessage.next_retry_at, EmailOutboxMessage.id)
+                   .limit(EMAIL_OUTBOX_BATCH_SIZE)]
+            if not due:
+                return False
+            rows = self._claim(session, due)
+            if not rows:
+                return False
+            self._count('batches')
+            return self._send_batch(session, rows)
+
+    def _claim(self, session: Session, ids: Iterable[int]) -> List[EmailOutboxMessage]:
+        """Chuyển pending -> sending từng dòng; dòng đã bị worker khác lấy thì bỏ qua"""
+        now = datetime.utcnow()
+        claimed = []
+        for row_id in ids:
+            updated = (session.query(EmailOutboxMessage)
+                       .filter(EmailOutboxMessage.id == row_id, EmailOutboxMessage.state == STATE_PENDING)
+                       .update({'state': STATE_SENDING, 'updated_at': now}, synchronize_session=False))
+            if updated:
+                claimed.append(row_id)
+        session.commit()
+        if not claimed:
+            return []
+        return (session.query(EmailOutboxMessage)
+                .filter(EmailOutboxMessage.id.in_(claimed))
+                .order_by(EmailOutboxMessage.id)
+                .all())
+
+    def _send_batch(self, session: Session, rows: List[EmailOutboxMessage]) -> bool:
+        """Gửi lần lượt; kết quả từng email commit ngay sau khi gửi, kèm gia hạn lease cho các email còn lại
+
+        Cả lô có thể lâu hơn EMAIL_OUTBOX_LEASE_SECONDS (mỗi email tới SMTP_TIMEOUT giây): nếu chỉ commit
+        cuối lô, worker của process khác sẽ thu hồi các dòng 'sending' đang gửi dở và gửi lại lần nữa
+        """
+        sent = 0
+        for index, row in enumerate(rows):
+            row.attempts = (row.attempts or 0) + 1
+            remaining = rows[index + 1:]
+            try:
+                refused = self._connection.send(row.sender, list(row.recipients), row.message)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"[:2000]
+                row.last_error = error
+                if is_permanent_error(e):
+                    # Chỉ email này bị từ chối (smtplib đã RSET) -> kết nối vẫn dùng tiếp cho email sau
+                    row.state = STATE_FAILED
+                    self._count('failed')
+                    logger.error(f"Email #{row.id} ({row.kind}) bị từ chối: {error}")
+                    self._finish(session, row, remaining, STATUS_ERROR, 'Không thể gửi email')
+                    continue
+
+                # Lỗi kết nối / đăng nhập / 4xx: đóng kết nối, email này backoff theo số lần thử,
+                # các email còn lại trong lô chờ 1 nhịp backoff rồi thử lại (không đốt lượt thử của chúng)
+                self._connection.close()
+                if row.attempts >= EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    row.state = STATE_FAILED
+                    self._count('failed')
+                    status, text = STATUS_ERROR, 'Không thể gửi email'
+                    logger.error(f"Email #{row.id} ({row.kind}) gửi thất bại sau {row.attempts} lần: {error}")
+                else:
+                    delay = backoff_seconds(row.attempts)
+                    row.state = STATE_PENDING
+                    row.next_retry_at = datetime.utcnow() + timedelta(seconds=delay)
+                    self._count('retried')
+                    status, text = STATUS_SENDING, f'Gửi email lỗi, sẽ thử lại sau {int(delay)} giây...'
+                    logger.warning(f"Email #{row.id} ({row.kind}) lỗi lần {row.attempts}, thử lại sau {delay:.0f}s: {error}")
+                retry_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(1))
+                for rest in remaining:
+                    rest.state = STATE_PENDING
+                    rest.next_retry_at = retry_at
+                self._finish(session, row, remaining, status, text)
+                break
+
+            row.state = STATE_SENT
+            row.sent_at = datetime.utcnow()
+            row.last_error = f"Người nhận bị từ chối: {refused}"[:2000] if refused else None
+            sent += 1
+            self._count('sent')
+            self._finish(session, row, remaining, STATUS_SUCCESS, 'Email đã được gửi thành công')
+
+        if sent:
+            logger.info(f"Outbox email: đã gửi {sent}/{len(rows)} email")
+        return sent > 0
+
+    def _finish(self, session: Session, row: EmailOutboxMessage, remaining: List[EmailOutboxMessage],
+                status: str, text: str) -> None:
+        """Commit kết quả 1 email (+ updated_at mới cho các email chưa gửi trong lô) rồi mới publish trạng thái"""
+        now = datetime.utcnow()
+        row.updated_at = now
+        for rest in remaining:
+            rest.updated_at = now
+        session.commit()
+        self.publish_status(row.request_id, row.user_id, status, text)
+
+    def _purge_sent(self, session: Session) -> None:
+        """Xoá dòng 'sent' cũ (tối đa 1 lần / giờ)"""
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(days=EMAIL_OUTBOX_SENT_RETENTION_DAYS)
+        session.query(EmailOutboxMessage).filter(
+            EmailOutboxMessage.state == STATE_SENT, EmailOutboxMessage.sent_at < cutoff
+        ).delete(synchronize_session=False)
+
+    def stats(self) -> dict:
+        counts = {STATE_PENDING: 0, STATE_SENDING: 0, STATE_SENT: 0, STATE_FAILED: 0}
+        oldest_pending = None
+        if self._engine is not None:
+            with self._session() as session:
+                for state, count in session.query(EmailOutboxMessage.state, func.count(EmailOutboxMessage.id)) \
+                        .group_by(EmailOutboxMessage.state).all():
+                    counts[state] = count
+                oldest_pending = session.query(func.min(EmailOutboxMessage.created_at)) \
+                    .filter(EmailOutboxMessage.state == STATE_PENDING).scalar()
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return dict(
+            counters,
+            states=counts,
+            oldest_pending_at=oldest_pending.isoformat(timespec='seconds') if oldest_pending else None,
+            smtp_connects=self._connection.connects,
+            smtp_reconnects=self._connection.reconnects,
+            smtp_connection_open=self._connection.is_open,
+            running=bool(self._thread and self._thread.is_alive()),
+            max_attempts=EMAIL_OUTBOX_MAX_ATTEMPTS,
+        )
+
+
+# Global instance dùng cho app.py và utils/email_utils.py
+email_outbox = EmailOutbox()
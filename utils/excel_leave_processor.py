@@ -4,7 +4,7 @@ Xử lý dữ liệu nghỉ phép cho việc xuất Excel với tách từng ng
 """
 
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterator, Tuple
 import sys
 
 
@@ -459,8 +459,14 @@ def process_leave_requests_for_excel(leave_requests) -> List[Dict]:
     Returns:
         List of dictionaries, mỗi dict là một dòng trong Excel
     """
-    all_daily_leaves = []
-    
+    return list(iter_leave_requests_for_excel(leave_requests))
+
+
+def iter_leave_requests_for_excel(leave_requests) -> Iterator[Dict]:
+    """
+    Giống process_leave_requests_for_excel nhưng sinh từng dòng theo từng đơn,
+    dùng cho export streaming (leave_requests có thể là query.yield_per(...))
+    """
     for request in leave_requests:
         try:
             # Kiểm tra xem có ngày lẻ không
@@ -483,7 +489,7 @@ def process_leave_requests_for_excel(leave_requests) -> List[Dict]:
                 # Không có ngày lẻ, xử lý bình thường
                 daily_leaves = split_leave_by_days(request)
             
-            all_daily_leaves.extend(daily_leaves)
+            yield from daily_leaves
             
         except Exception as e:
             try:
@@ -502,7 +508,7 @@ def process_leave_requests_for_excel(leave_requests) -> List[Dict]:
                 to_time = datetime.strptime("16:30", "%H:%M").time()
             
             try:
-                all_daily_leaves.append({
+                fallback_row = {
                     'employee_name': getattr(request, 'employee_name', 'Unknown'),
                     'employee_code': getattr(request, 'employee_code', ''),
                     'team': getattr(request, 'team', 'Unknown'),
@@ -519,11 +525,11 @@ def process_leave_requests_for_excel(leave_requests) -> List[Dict]:
                         'days': 1.0
                     },
                     'fractional_days': 1.0
-                })
+                }
             except Exception as fallback_err:
                 try:
                     print(f"[ERROR] Error creating fallback data for request {request.id}: {fallback_err}", flush=True, file=sys.stderr)
                 except Exception:
                     pass
-    
-    return all_daily_leaves
+                continue
+            yield fallback_row
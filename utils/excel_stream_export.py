@@ -0,0 +1,184 @@
+"""
+Pipeline xuất Excel dạng streaming dùng chung cho các endpoint export
+
+    - Đọc dữ liệu theo lô với Query.yield_per() thay vì .all()
+    - Ghi bằng openpyxl write-only (mỗi dòng được ghi thẳng xuống file tạm, không giữ cả sheet trong RAM)
+    - Style khai báo 1 lần dưới dạng NamedStyle và dùng lại cho mọi ô
+    - Trả file về client theo từng khối (hoặc lưu ra đường dẫn chỉ định)
+
+Bộ nhớ gần như không đổi khi số dòng tăng.
+"""
+import logging
+import os
+import tempfile
+from typing import Iterable, Iterator, Optional, Sequence, Union
+from urllib.parse import quote
+
+from flask import Response
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+logger = logging.getLogger(__name__)
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Số bản ghi đọc mỗi lô từ DB
+DEFAULT_CHUNK_SIZE = int(os.environ.get('EXCEL_EXPORT_CHUNK_SIZE', 500))
+# Kích thước khối khi gửi file về client
+STREAM_BLOCK_SIZE = 64 * 1024
+
+_THIN = Side(style='thin')
+_THIN_BORDER = Border(left=_THIN, right=_THIN, top=_THIN, bottom=_THIN)
+_CENTER = Alignment(horizontal='center', vertical='center')
+_ORANGE_FILL = PatternFill(start_color='FFA500', end_color='FFA500', fill_type='solid')
+
+
+def _solid_fill(color: str) -> PatternFill:
+    return PatternFill(start_color=color, end_color=color, fill_type='solid')
+
+
+# Tên style -> thuộc tính. Mỗi workbook đăng ký toàn bộ 1 lần, các ô chỉ tham chiếu theo tên.
+NAMED_STYLES = {
+    # Header
+    'export_header': {'font': Font(bold=True), 'alignment': _CENTER, 'border': _THIN_BORDER},
+    'export_header_blue': {'font': Font(bold=True, color='FFFFFF', size=11), 'fill': _solid_fill('4472C4'),
+                           'alignment': _CENTER},
+    'export_header_navy': {'font': Font(bold=True, color='FFFFFF', size=12), 'fill': _solid_fill('366092'),
+                           'alignment': _CENTER},
+    # Ô dữ liệu không viền
+    'export_center': {'alignment': _CENTER},
+    'export_left': {'alignment': Alignment(vertical='center', wrap_text=False)},
+    'export_center_wrap': {'alignment': Alignment(horizontal='center', vertical='center', wrap_text=True)},
+    # Dòng được tô cam (vd: có đơn đi trễ/về sớm)
+    'export_center_highlight': {'alignment': _CENTER, 'fill': _ORANGE_FILL},
+    'export_left_highlight': {'alignment': Alignment(vertical='center'), 'fill': _ORANGE_FILL},
+    # Ô dữ liệu dạng lưới có viền
+    'export_grid_date': {'number_format': 'dd/mm/yyyy', 'alignment': _CENTER, 'border': _THIN_BORDER},
+    'export_grid_left': {'alignment': Alignment(horizontal='left', vertical='center'), 'border': _THIN_BORDER},
+    'export_grid_text': {'number_format': '@', 'alignment': _CENTER, 'border': _THIN_BORDER},
+    'export_grid_time': {'number_format': 'HH:mm', 'alignment': _CENTER, 'border': _THIN_BORDER},
+}
+
+
+def _build_named_style(name: str, attrs: dict) -> NamedStyle:
+    style = NamedStyle(name=name)
+    for attr, value in attrs.items():
+        setattr(style, attr, value)
+    return style
+
+
+def iter_query_in_chunks(query, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator:
+    """
+    Duyệt kết quả query theo từng lô chunk_size bản ghi (yield_per) thay vì nạp hết bằng .all().
+
+    Lưu ý: chỉ dùng joinedload cho quan hệ many-to-one (vd: Attendance.user);
+    quan hệ collection không dùng được với yield_per.
+    """
+    return iter(query.yield_per(chunk_size))
+
+
+def content_disposition(filename: str, ascii_fallback: Optional[str] = None) -> str:
+    """Header Content-Disposition với tên file UTF-8 (RFC 5987) + tên ASCII dự phòng"""
+    if ascii_fallback:
+        return f"attachment; filename=\"{ascii_fallback}\"; filename*=UTF-8''{quote(filename)}"
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+
+def _iter_file_and_remove(path: str, block_size: int = STREAM_BLOCK_SIZE) -> Iterator[bytes]:
+    """Đọc file theo khối rồi xoá file tạm khi gửi xong (kể cả khi client ngắt kết nối)"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(block_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Không thể xoá file export tạm {path}: {e}")
+
+
+class StreamingXlsxWriter:
+    """
+    Ghi 1 sheet Excel ở chế độ write-only.
+
+    Độ rộng cột và chiều cao dòng phải khai báo trước khi ghi dòng đầu tiên
+    (write-only không cho chỉnh lại sau), nên được truyền vào constructor.
+
+    Ví dụ:
+        writer = StreamingXlsxWriter("Sheet", headers, column_widths=[12, 25])
+        for record in iter_query_in_chunks(query):
+            writer.append([record.a, record.b], styles=['export_center', 'export_left'])
+        writer.set_auto_filter()
+        return writer.to_response("file.xlsx")
+    """
+
+    def __init__(self, title: str, headers: Sequence[str], column_widths: Sequence[float] = (),
+                 header_style: str = 'export_header', row_height: Optional[float] = None):
+        self.workbook = Workbook(write_only=True)
+        for name, attrs in NAMED_STYLES.items():
+            self.workbook.add_named_style(_build_named_style(name, attrs))
+
+        self.worksheet = self.workbook.create_sheet(title=title)
+        for col_idx, width in enumerate(column_widths, 1):
+            self.worksheet.column_dimensions[get_column_letter(col_idx)].width = width
+        if row_height:
+            self.worksheet.sheet_format.defaultRowHeight = row_height
+            self.worksheet.sheet_format.customHeight = True
+
+        self.headers = list(headers)
+        self.rows_written = 0
+        self.worksheet.append([self.cell(header, header_style) for header in self.headers])
+
+    def cell(self, value, style: Optional[str] = None) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self.worksheet, value=value)
+        if style:
+            cell.style = style
+        return cell
+
+    def append(self, values: Iterable, styles: Union[str, Sequence[Optional[str]], None] = None) -> None:
+        """
+        Ghi 1 dòng dữ liệu.
+
+        styles: tên 1 style cho cả dòng, hoặc danh sách style theo từng cột (None = không style)
+        """
+        values = list(values)
+        if styles is None or isinstance(styles, str):
+            styles = [styles] * len(values)
+        self.worksheet.append([self.cell(value, style) for value, style in zip(values, styles)])
+        self.rows_written += 1
+
+    def set_auto_filter(self) -> None:
+        """Bật lọc tự động cho header (ghi ở cuối sheet nên gọi được sau khi đã ghi dữ liệu)"""
+        last_col = get_column_letter(len(self.headers))
+        self.worksheet.auto_filter.ref = f"A1:{last_col}{self.rows_written + 1}"
+
+    def save(self, path: str) -> str:
+        """Lưu workbook ra file; workbook write-only chỉ lưu được 1 lần"""
+        self.workbook.save(path)
+        return path
+
+    def save_to_tempfile(self) -> str:
+        fd, path = tempfile.mkstemp(prefix='export_', suffix='.xlsx')
+        os.close(fd)
+        try:
+            return self.save(path)
+        except Exception:
+            os.remove(path)
+            raise
+
+    def to_response(self, filename: str, ascii_fallback: Optional[str] = None,
+                    no_cache: bool = True) -> Response:
+        """Lưu ra file tạm rồi stream về client theo khối; file tạm tự xoá khi gửi xong"""
+        path = self.save_to_tempfile()
+        response = Response(_iter_file_and_remove(path), mimetype=XLSX_MIMETYPE, direct_passthrough=True)
+        response.headers['Content-Disposition'] = content_disposition(filename, ascii_fallback)
+        response.headers['Content-Length'] = str(os.path.getsize(path))
+        if no_cache:
+            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
+        return response
@@ -0,0 +1,83 @@
+"""
+Quota gọi Google API dùng chung cho cả tiến trình
+
+Trước đây mỗi GoogleDriveAPI() tự đếm lượt gọi trong 60s (_api_call_timestamps); các instance
+tạo ở nhiều thread (queue worker, phê duyệt hàng loạt, keep-alive...) không thấy nhau nên tổng
+vẫn vượt ngưỡng 60 lượt/phút của Google và ăn 429.
+
+    - Cửa sổ trượt GOOGLE_API_QUOTA_PER_MINUTE lượt / 60s, thread-safe, ngủ ngoài lock
+    - Gặp 429 ở bất kỳ thread nào -> pause() chặn mọi thread trong khoảng backoff đó
+    - GOOGLE_SHEETS_SYNC_WORKERS: số spreadsheet xử lý song song trong batch update
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_QUOTA_PER_MINUTE = int(os.environ.get('GOOGLE_API_QUOTA_PER_MINUTE', 55))
+GOOGLE_SHEETS_SYNC_WORKERS = int(os.environ.get('GOOGLE_SHEETS_SYNC_WORKERS', 4))
+
+
+class GoogleQuotaLimiter:
+    """Giới hạn số lượt gọi API trong cửa sổ trượt, chia sẻ giữa mọi thread"""
+
+    def __init__(self, max_calls: int = GOOGLE_API_QUOTA_PER_MINUTE, window_seconds: float = 60.0):
+        self.max_calls = max(1, max_calls)
+        self.window_seconds = window_seconds
+        self._calls = deque()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'waits': 0, 'wait_seconds': 0.0, 'pauses': 0}
+
+    def acquire(self) -> float:
+        """Chờ tới khi còn lượt gọi; trả về số giây đã chờ"""
+        started = time.monotonic()
+        waited_once = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.window_seconds:
+                    self._calls.popleft()
+                wait = self._paused_until - now
+                if wait <= 0 and len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    self._stats['calls'] += 1
+                    waited = now - started
+                    if waited_once:
+                        self._stats['wait_seconds'] += waited
+                    return waited
+                if wait <= 0:
+                    wait = self.window_seconds - (now - self._calls[0])
+                if not waited_once:
+                    self._stats['waits'] += 1
+                    waited_once = True
+            # Ngủ từng đoạn ngắn để pause() / lượt vừa nhả được thấy sớm
+            time.sleep(min(max(wait, 0.05), 5.0))
+
+    def pause(self, seconds: float) -> None:
+        """Bị 429: mọi thread chờ ít nhất seconds giây trước lượt gọi kế tiếp"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats['pauses'] += 1
+        logger.warning(f"Google API bị giới hạn quota, tạm dừng mọi lượt gọi {seconds:.0f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            in_window = sum(1 for t in self._calls if now - t < self.window_seconds)
+            paused_for = max(0.0, self._paused_until - now)
+        return dict(
+            self._stats,
+            wait_seconds=round(self._stats['wait_seconds'], 1),
+            calls_in_window=in_window,
+            max_calls=self.max_calls,
+            paused_for_seconds=round(paused_for, 1),
+            workers=GOOGLE_SHEETS_SYNC_WORKERS,
+        )
+
+
+# Global instance dùng cho GoogleDriveAPI._check_and_wait_rate_limit
+google_quota = GoogleQuotaLimiter()
@@ -0,0 +1,228 @@
+"""
+Lịch ngày lễ / ngày làm việc giữ trong process
+
+Trước đây /api/get-day-type query Holiday mỗi lần gọi (form nghỉ phép gọi liên tục khi đổi ngày),
+/api/get-excluded-days duyệt từng ngày trên khoảng bất kỳ client gửi lên (không giới hạn),
+dashboard admin đếm ngày lễ năm hiện tại bằng 1 query mỗi lần mở.
+
+    - Nạp ngày lễ theo năm (1 query / năm), dựng mảng loại ngày 1 byte / ngày
+      (ưu tiên: Lễ Việt Nam > Cuối tuần > Lễ Nhật) + mảng cộng dồn số ngày làm việc
+    - Loại ngày O(1), số ngày làm việc O(số năm), danh sách ngày loại trừ O(độ dài khoảng) - không query DB
+    - describe_ranges: nhiều khoảng ngày trong 1 lần gọi
+    - /admin/holidays thêm / sửa / xoá -> invalidate(); HOLIDAY_CALENDAR_TTL là lưới an toàn
+      cho thay đổi từ worker khác
+    - Khoảng dài hơn HOLIDAY_CALENDAR_MAX_RANGE_DAYS ngày bị từ chối (ValueError)
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+HOLIDAY_CALENDAR_TTL = int(os.environ.get('HOLIDAY_CALENDAR_TTL', 300))
+HOLIDAY_CALENDAR_MAX_RANGE_DAYS = int(os.environ.get('HOLIDAY_CALENDAR_MAX_RANGE_DAYS', 732))
+# Nạp lỗi (vd: bảng holidays chưa tồn tại) -> dùng lịch chỉ có cuối tuần, thử lại sau chừng này giây
+_ERROR_RETRY_SECONDS = 30
+
+NORMAL = 0
+WEEKEND = 1
+VIETNAMESE_HOLIDAY = 2
+JAPANESE_HOLIDAY = 3
+
+DAY_TYPES = ('normal', 'weekend', 'vietnamese_holiday', 'japanese_holiday')
+_HOLIDAY_CODES = {'vietnamese_holiday': VIETNAMESE_HOLIDAY, 'japanese_holiday': JAPANESE_HOLIDAY}
+
+# (ngày, holiday_type, tên) của các ngày lễ trong 1 năm
+HolidayLoader = Callable[[int], Iterable[Tuple[date, str, Optional[str]]]]
+
+
+class _YearCalendar:
+    """Loại ngày của từng ngày trong năm + số ngày làm việc cộng dồn"""
+
+    __slots__ = ('year', 'first', 'codes', 'workdays_before', 'names', 'holiday_count', 'loaded_at', 'expires_at')
+
+    def __init__(self, year: int, holidays: Iterable[Tuple[date, str, Optional[str]]], ttl: float):
+        self.year = year
+        self.first = date(year, 1, 1)
+        days = (date(year + 1, 1, 1) - self.first).days
+        first_weekday = self.first.weekday()
+        codes = bytearray(WEEKEND if (first_weekday + i) % 7 >= 5 else NORMAL for i in range(days))
+
+        self.names: Dict[date, str] = {}
+        self.holiday_count = 0
+        for holiday_date, holiday_type, name in holidays:
+            code = _HOLIDAY_CODES.get(holiday_type)
+            if code is None or holiday_date.year != year:
+                continue
+            self.holiday_count += 1
+            self.names[holiday_date] = name or ''
+            i = (holiday_date - self.first).days
+            # Lễ Việt Nam luôn thắng; lễ Nhật chỉ áp dụng cho ngày không phải cuối tuần
+            if code == VIETNAMESE_HOLIDAY or codes[i] == NORMAL:
+                codes[i] = code
+        self.codes = bytes(codes)
+
+        # workdays_before[i] = số ngày thường trong [1/1, ngày thứ i)
+        workdays = array('H', [0]) * (days + 1)
+        for i, code in enumerate(self.codes):
+            workdays[i + 1] = workdays[i] + (code == NORMAL)
+        self.workdays_before = workdays
+        self.loaded_at = time.monotonic()
+        self.expires_at = self.loaded_at + ttl
+
+    def index(self, day: date) -> int:
+        return (day - self.first).days
+
+
+class HolidayCalendar:
+    """Cache lịch theo năm, thread-safe; loader đọc ngày lễ của 1 năm từ DB"""
+
+    def __init__(self, ttl_seconds: int = HOLIDAY_CALENDAR_TTL, max_range_days: int = HOLIDAY_CALENDAR_MAX_RANGE_DAYS):
+        self.ttl_seconds = ttl_seconds
+        self.max_range_days = max_range_days
+        self._loader: Optional[HolidayLoader] = None
+        self._years: Dict[int, _YearCalendar] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._loads = 0
+        self._load_errors = 0
+        self._invalidations = 0
+
+    def set_loader(self, loader: HolidayLoader) -> None:
+        self._loader = loader
+        self.invalidate(reason='set_loader')
+
+    # ------------------------------------------------------------------
+    # Cache theo năm
+    # ------------------------------------------------------------------
+
+    def _year(self, year: int) -> _YearCalendar:
+        calendar = self._years.get(year)
+        if calendar is not None and time.monotonic() < calendar.expires_at:
+            self._hits += 1
+            return calendar
+        with self._lock:
+            calendar = self._years.get(year)
+            if calendar is not None and time.monotonic() < calendar.expires_at:
+                return calendar
+            try:
+                holidays = list(self._loader(year)) if self._loader else []
+                calendar = _YearCalendar(year, holidays, self.ttl_seconds)
+                self._loads += 1
+            except Exception as e:
+                self._load_errors += 1
+                logger.warning(f"Không nạp được ngày lễ năm {year}: {e}. Tạm chỉ tính cuối tuần")
+                calendar = _YearCalendar(year, [], _ERROR_RETRY_SECONDS)
+            self._years[year] = calendar
+            return calendar
+
+    def invalidate(self, year: Optional[int] = None, reason: str = 'invalidate') -> None:
+        """Gọi sau khi thêm / sửa / xoá ngày lễ (year=None: bỏ toàn bộ cache)"""
+        with self._lock:
+            if year is None:
+                self._years.clear()
+            else:
+                self._years.pop(year, None)
+            self._invalidations += 1
+        logger.info(f"Lịch ngày lễ sẽ được nạp lại ({reason}{'' if year is None else f', năm {year}'})")
+
+    # ------------------------------------------------------------------
+    # Tra cứu
+    # ------------------------------------------------------------------
+
+    def day_type(self, day: date) -> str:
+        calendar = self._year(day.year)
+        return DAY_TYPES[calendar.codes[calendar.index(day)]]
+
+    def holiday_name(self, day: date) -> Optional[str]:
+        """Tên ngày lễ ('' nếu không đặt tên), None nếu không phải ngày lễ"""
+        return self._year(day.year).names.get(day)
+
+    def holiday_count(self, year: int) -> int:
+        return self._year(year).holiday_count
+
+    def _check_range(self, from_date: date, to_date: date) -> None:
+        if from_date > to_date:
+            raise ValueError('from_date phải nhỏ hơn hoặc bằng to_date')
+        if (to_date - from_date).days + 1 > self.max_range_days:
+            raise ValueError(f'Khoảng ngày tối đa {self.max_range_days} ngày')
+
+    def _segments(self, from_date: date, to_date: date):
+        """(lịch năm, index đầu, index cuối + 1) cho từng năm mà khoảng đi qua"""
+        for year in range(from_date.year, to_date.year + 1):
+            calendar = self._year(year)
+            start = calendar.index(max(from_date, calendar.first))
+            end = calendar.index(min(to_date, date(year, 12, 31))) + 1
+            yield calendar, start, end
+
+    def day_types(self, from_date: date, to_date: date) -> List[str]:
+        """Loại ngày của từng ngày trong [from_date, to_date]"""
+        self._check_range(from_date, to_date)
+        return [DAY_TYPES[code] for calendar, start, end in self._segments(from_date, to_date)
+                for code in calendar.codes[start:end]]
+
+    def workday_count(self, from_date: date, to_date: date) -> int:
+        """Số ngày thường (không cuối tuần / lễ) trong [from_date, to_date]"""
+        self._check_range(from_date, to_date)
+        return sum(calendar.workdays_before[end] - calendar.workdays_before[start]
+                   for calendar, start, end in self._segments(from_date, to_date))
+
+    def excluded_days(self, from_date: date, to_date: date) -> List[dict]:
+        """Các ngày loại trừ khi tính ngày phép (cùng định dạng /api/get-excluded-days)"""
+        self._check_range(from_date, to_date)
+        excluded = []
+        for calendar, start, end in self._segments(from_date, to_date):
+            codes = calendar.codes
+            for i in range(start, end):
+                code = codes[i]
+                if code == NORMAL:
+                    continue
+                day = calendar.first + timedelta(days=i)
+                if code == WEEKEND:
+                    reason = f"Cuối tuần ({'Thứ 7' if day.weekday() == 5 else 'Chủ nhật'})"
+                    name = ''
+                else:
+                    reason = 'Lễ Việt Nam' if code == VIETNAMESE_HOLIDAY else 'Lễ Nhật Bản'
+                    name = calendar.names.get(day, '')
+                excluded.append({'date': day.strftime('%Y-%m-%d'), 'type': DAY_TYPES[code], 'reason': reason, 'name': name})
+        return excluded
+
+    def describe_range(self, from_date: date, to_date: date) -> dict:
+        excluded = self.excluded_days(from_date, to_date)
+        total_days = (to_date - from_date).days + 1
+        return {
+            'from_date': from_date.strftime('%Y-%m-%d'),
+            'to_date': to_date.strftime('%Y-%m-%d'),
+            'total_days': total_days,
+            'workday_count': total_days - len(excluded),
+            'excluded_days': excluded,
+            'total_excluded': len(excluded),
+        }
+
+    def describe_ranges(self, ranges: Sequence[Tuple[date, date]]) -> List[dict]:
+        """describe_range cho nhiều khoảng; mỗi năm chỉ nạp 1 lần cho cả lô"""
+        for from_date, to_date in ranges:
+            self._check_range(from_date, to_date)
+        return [self.describe_range(from_date, to_date) for from_date, to_date in ranges]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        years = dict(self._years)
+        return {
+            'years': {year: {'holidays': cal.holiday_count, 'age_seconds': round(now - cal.loaded_at, 1)}
+                      for year, cal in sorted(years.items())},
+            'hits': self._hits,
+            'loads': self._loads,
+            'load_errors': self._load_errors,
+            'invalidations': self._invalidations,
+            'ttl_seconds': self.ttl_seconds,
+            'max_range_days': self.max_range_days,
+        }
+
+
+# Global instance - loader gắn trong app.py (đọc bảng holidays)
+holiday_calendar = HolidayCalendar()
@@ -0,0 +1,99 @@
+"""
+Import lười cho các thư viện nặng (reportlab, openpyxl, Google API, OpenCV...)
+
+Chỉ vài route dùng tới các thư viện này nhưng trước đây app.py import hết lúc khởi động,
+nên mỗi worker gunicorn / mỗi lần chạy script đều tốn thời gian + RAM cho chúng.
+
+    canvas = lazy('reportlab.pdfgen.canvas')          # module
+    Table = lazy('reportlab.platypus', 'Table')       # 1 thuộc tính trong module
+
+Đối tượng trả về là proxy: module thật chỉ được import ở lần đầu gọi / truy cập thuộc tính.
+Không dùng proxy làm class cha, trong isinstance() hay trong mệnh đề except
+- những chỗ đó cần import trực tiếp trong hàm.
+
+IMPORT_BUDGET_MODE=1: ghi log mỗi lần 1 thư viện nặng thực sự được nạp (xem route nào kéo nó vào).
+"""
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BUDGET_MODE = os.environ.get('IMPORT_BUDGET_MODE', '0') == '1'
+
+_resolve_lock = threading.RLock()
+# module -> số giây import (chỉ các module đi qua lazy())
+_load_times: Dict[str, float] = {}
+
+
+def module_available(module_name: str) -> bool:
+    """Kiểm tra thư viện đã cài hay chưa mà không import nó"""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyObject:
+    """Proxy tới module/thuộc tính, import ở lần dùng đầu tiên"""
+
+    __slots__ = ('_lazy_module', '_lazy_attr', '_lazy_target')
+
+    def __init__(self, module_name: str, attr: Optional[str] = None):
+        object.__setattr__(self, '_lazy_module', module_name)
+        object.__setattr__(self, '_lazy_attr', attr)
+        object.__setattr__(self, '_lazy_target', None)
+
+    def _resolve(self) -> Any:
+        target = object.__getattribute__(self, '_lazy_target')
+        if target is not None:
+            return target
+        module_name = object.__getattribute__(self, '_lazy_module')
+        attr = object.__getattribute__(self, '_lazy_attr')
+        with _resolve_lock:
+            target = object.__getattribute__(self, '_lazy_target')
+            if target is None:
+                started = time.perf_counter()
+                module = importlib.import_module(module_name)
+                elapsed = time.perf_counter() - started
+                _load_times.setdefault(module_name, elapsed)
+                if IMPORT_BUDGET_MODE:
+                    logger.info(f"[IMPORT_BUDGET] Nạp {module_name} lần đầu: {elapsed * 1000:.1f}ms")
+                target = getattr(module, attr) if attr else module
+                object.__setattr__(self, '_lazy_target', target)
+        return target
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    # Cho giá trị dạng tuple (vd: A4) dùng được khi unpack / index
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __repr__(self) -> str:
+        module_name = object.__getattribute__(self, '_lazy_module')
+        attr = object.__getattribute__(self, '_lazy_attr')
+        loaded = object.__getattribute__(self, '_lazy_target') is not None
+        return f"<lazy {module_name}{'.' + attr if attr else ''}{'' if loaded else ' (chưa nạp)'}>"
+
+
+def lazy(module_name: str, attr: Optional[str] = None) -> LazyObject:
+    return LazyObject(module_name, attr)
+
+
+def loaded_lazy_modules() -> Dict[str, float]:
+    """Các thư viện đã được nạp qua lazy() và thời gian import (ms) - dùng cho trang thống kê/benchmark"""
+    return {name: round(seconds * 1000, 1) for name, seconds in _load_times.items()}
@@ -0,0 +1,98 @@
+"""
+Leave overlay cho các bản xuất chấm công
+Nạp toàn bộ đơn nghỉ đã duyệt giao với khoảng xuất trong 1 query và tra cứu theo (user_id, ngày)
+"""
+
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from database.models import LeaveRequest
+
+
+def _date_key(d: date) -> int:
+    """Đổi date thành số nguyên YYYYMMDD để so sánh với các cột ngày tách rời của LeaveRequest"""
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+# LeaveRequest lưu ngày theo từng phần (năm/tháng/ngày) -> ghép thành YYYYMMDD trong SQL
+_LEAVE_FROM_KEY = (
+    LeaveRequest.leave_from_year * 10000
+    + LeaveRequest.leave_from_month * 100
+    + LeaveRequest.leave_from_day
+)
+_LEAVE_TO_KEY = (
+    LeaveRequest.leave_to_year * 10000
+    + LeaveRequest.leave_to_month * 100
+    + LeaveRequest.leave_to_day
+)
+
+
+def load_approved_leaves(date_from: Optional[date], date_to: Optional[date],
+                         user_ids: Optional[Iterable[int]] = None, session=None):
+    """
+    Lấy tất cả đơn nghỉ đã duyệt có khoảng nghỉ giao với [date_from, date_to] trong MỘT query.
+
+    Args:
+        date_from: Ngày bắt đầu khoảng xuất (None = không giới hạn)
+        date_to: Ngày kết thúc khoảng xuất (None = không giới hạn)
+        user_ids: Giới hạn theo danh sách user (None = tất cả)
+        session: Session dùng để đọc (None = db.session; vd: snapshot báo cáo)
+
+    Returns:
+        List LeaveRequest sắp xếp theo id tăng dần
+    """
+    query = LeaveRequest.query
+    if session is not None:
+        query = query.with_session(session)
+    query = query.filter(LeaveRequest.status == 'approved')
+    if date_to:
+        query = query.filter(_LEAVE_FROM_KEY <= _date_key(date_to))
+    if date_from:
+        query = query.filter(_LEAVE_TO_KEY >= _date_key(date_from))
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return []
+        query = query.filter(LeaveRequest.user_id.in_(user_ids))
+    return query.order_by(LeaveRequest.id.asc()).all()
+
+
+class LeaveOverlayIndex:
+    """
+    Chỉ mục trong bộ nhớ: (user_id, date) -> LeaveRequest đã duyệt phủ ngày đó.
+
+    Khi nhiều đơn cùng phủ một ngày, giữ đơn có id nhỏ nhất (giống `.first()` của query cũ).
+    """
+
+    def __init__(self, leave_requests, date_from: Optional[date] = None, date_to: Optional[date] = None):
+        self._index: Dict[Tuple[int, date], LeaveRequest] = {}
+        for leave in leave_requests:
+            try:
+                start = date(leave.leave_from_year, leave.leave_from_month, leave.leave_from_day)
+                end = date(leave.leave_to_year, leave.leave_to_month, leave.leave_to_day)
+            except (TypeError, ValueError):
+                continue  # Bỏ qua đơn có ngày không hợp lệ
+
+            # Cắt khoảng nghỉ theo khoảng xuất để không sinh key thừa
+            if date_from and start < date_from:
+                start = date_from
+            if date_to and end > date_to:
+                end = date_to
+
+            current = start
+            while current <= end:
+                self._index.setdefault((leave.user_id, current), leave)
+                current += timedelta(days=1)
+
+    @classmethod
+    def for_window(cls, date_from: Optional[date], date_to: Optional[date],
+                   user_ids: Optional[Iterable[int]] = None, session=None):
+        """Nạp đơn nghỉ của khoảng xuất và dựng chỉ mục"""
+        return cls(load_approved_leaves(date_from, date_to, user_ids, session=session), date_from, date_to)
+
+    def get(self, user_id: int, day: date) -> Optional[LeaveRequest]:
+        """Tra cứu O(1) đơn nghỉ phủ ngày `day` của `user_id`"""
+        return self._index.get((user_id, day))
+
+    def __len__(self):
+        return len(self._index)
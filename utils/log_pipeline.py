@@ -0,0 +1,273 @@
+"""
+Pipeline log không chặn request (QueueHandler -> QueueListener)
+
+Trước đây app.py gán print = _safe_print: mỗi lần in kiểm tra lại stream, flush, và các handler
+phê duyệt / đồng bộ Google Sheet / hàng chờ in hàng chục dòng flush=True cho mỗi request.
+
+    - Logger theo phân hệ dưới "attendance": sheets, approval, license, chatbot, export (+ app)
+    - Request chỉ đưa LogRecord vào hàng đợi (put_nowait, đầy thì bỏ và đếm); 1 thread
+      QueueListener ghi ra console / file xoay vòng
+    - Hot path gọi sheets_log.debug("... %s", x): level tắt -> không format, không I/O
+    - Giới hạn tần suất: cùng 1 dòng (cùng logger + mẫu câu) tối đa LOG_REPEAT_LIMIT lần
+      mỗi LOG_REPEAT_WINDOW giây, phần bị bỏ được báo ở dòng kế tiếp
+    - log_print: thay print trong app.py cho các chỗ còn lại - suy ra level từ emoji đầu dòng
+      (❌ -> ERROR, ⚠️ -> WARNING, còn lại INFO) và phân hệ từ tag [SHEET...] / [LICENSE...]...
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Đường dẫn file log (để trống: chỉ ghi console)
+LOG_FILE = os.environ.get('LOG_FILE', 'logs/app.log')
+LOG_FILE_MAX_MB = int(os.environ.get('LOG_FILE_MAX_MB', 10))
+LOG_FILE_BACKUPS = int(os.environ.get('LOG_FILE_BACKUPS', 5))
+LOG_CONSOLE = os.environ.get('LOG_CONSOLE', '1') == '1'
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_REPEAT_LIMIT = int(os.environ.get('LOG_REPEAT_LIMIT', 20))
+LOG_REPEAT_WINDOW = float(os.environ.get('LOG_REPEAT_WINDOW', 60))
+
+ROOT_LOGGER = 'attendance'
+SUBSYSTEMS = ('sheets', 'approval', 'license', 'chatbot', 'export')
+
+_FORMAT = '%(asctime)s %(levelname)s [%(name)s] %(message)s'
+
+app_log = logging.getLogger(f'{ROOT_LOGGER}.app')
+sheets_log = logging.getLogger(f'{ROOT_LOGGER}.sheets')
+approval_log = logging.getLogger(f'{ROOT_LOGGER}.approval')
+license_log = logging.getLogger(f'{ROOT_LOGGER}.license')
+chatbot_log = logging.getLogger(f'{ROOT_LOGGER}.chatbot')
+export_log = logging.getLogger(f'{ROOT_LOGGER}.export')
+
+
+def _subsystem_level(name: str) -> Optional[str]:
+    """LOG_LEVEL_SHEETS=DEBUG... ghi đè level cho 1 phân hệ"""
+    value = os.environ.get(f'LOG_LEVEL_{name.upper()}')
+    return value.upper() if value else None
+
+
+class RepeatRateLimitFilter(logging.Filter):
+    """Bỏ bớt dòng lặp lại: mỗi (logger, level, mẫu câu) tối đa limit lần / window giây"""
+
+    def __init__(self, limit: int = LOG_REPEAT_LIMIT, window: float = LOG_REPEAT_WINDOW, max_keys: int = 5000):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._counters: Dict[Tuple, list] = {}  # key -> [bắt đầu cửa sổ, số dòng, số dòng đã bỏ]
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else id(record.msg))
+        now = record.created
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                if len(self._counters) >= self.max_keys:
+                    self._counters.clear()
+                self._counters[key] = [now, 1, 0]
+                return True
+            if now - counter[0] >= self.window:
+                suppressed = counter[2]
+                counter[:] = [now, 1, 0]
+                if suppressed and isinstance(record.msg, str):
+                    record.msg = f"(đã bỏ {suppressed} dòng lặp lại) " + record.msg
+                return True
+            counter[1] += 1
+            if counter[1] <= self.limit:
+                return True
+            counter[2] += 1
+            self.suppressed_total += 1
+            return False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hàng đợi đầy -> bỏ record (request không bao giờ chờ I/O log)"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Chỉ ghép args ngay trong thread request (đối tượng ORM... có thể đổi / không dùng được ở thread khác);
+        # format dòng đầy đủ (thời gian, level...) để listener làm
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _ConsoleHandler(logging.StreamHandler):
+    """Ghi ra sys.stdout hiện tại; stream bị đóng (Werkzeug reloader...) thì bỏ qua, không raise"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        stream = sys.stdout
+        try:
+            if stream is None or stream.closed:
+                stream = sys.stderr
+            if stream is None or stream.closed:
+                return
+        except Exception:
+            return
+        self.stream = stream
+        super().emit(record)
+
+    def handleError(self, record: logging.LogRecord) -> None:
+        pass
+
+
+class LogPipeline:
+    """Dựng hàng đợi + listener 1 lần cho mỗi process (tự dựng lại sau fork)"""
+
+    def __init__(self):
+        self.queue_handler: Optional[_NonBlockingQueueHandler] = None
+        self.rate_limit = RepeatRateLimitFilter()
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def setup(self) -> None:
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                return
+            root = logging.getLogger(ROOT_LOGGER)
+            root.setLevel(LOG_LEVEL)
+            root.propagate = False
+            for name in SUBSYSTEMS:
+                level = _subsystem_level(name)
+                if level:
+                    logging.getLogger(f'{ROOT_LOGGER}.{name}').setLevel(level)
+
+            if not self._handlers:
+                formatter = logging.Formatter(_FORMAT)
+                if LOG_CONSOLE:
+                    console = _ConsoleHandler()
+                    console.setFormatter(formatter)
+                    self._handlers.append(console)
+                if LOG_FILE:
+                    try:
+                        os.makedirs(os.path.dirname(LOG_FILE) or '.', exist_ok=True)
+                        file_handler = logging.handlers.RotatingFileHandler(
+                            LOG_FILE, maxBytes=LOG_FILE_MAX_MB * 1024 * 1024,
+                            backupCount=LOG_FILE_BACKUPS, encoding='utf-8', delay=True)
+                        file_handler.setFormatter(formatter)
+                        self._handlers.append(file_handler)
+                    except OSError as e:
+                        sys.stderr.write(f"Không mở được file log {LOG_FILE}: {e}\n")
+
+            log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            if self.queue_handler is None:
+                self.queue_handler = _NonBlockingQueueHandler(log_queue)
+                self.queue_handler.addFilter(self.rate_limit)
+                root.addHandler(self.queue_handler)
+            else:
+                self.queue_handler.queue = log_queue
+            self._listener = logging.handlers.QueueListener(log_queue, *self._handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def _after_fork(self) -> None:
+        # Thread listener không sống sót qua fork (gunicorn worker) -> dựng lại trong process con
+        self._listener = None
+        self._lock = threading.Lock()
+        if self.queue_handler is not None:
+            self.setup()
+
+    def stop(self) -> None:
+        listener = self._listener
+        if listener is not None and self._pid == os.getpid():
+            try:
+                listener.stop()  # Ghi nốt các dòng còn trong hàng đợi
+            except Exception:
+                pass
+            self._listener = None
+
+    def stats(self) -> dict:
+        return {
+            'level': logging.getLevelName(logging.getLogger(ROOT_LOGGER).level),
+            'subsystems': {name: logging.getLevelName(logging.getLogger(f'{ROOT_LOGGER}.{name}').getEffectiveLevel())
+                           for name in SUBSYSTEMS},
+            'queued': self.queue_handler.queue.qsize() if self.queue_handler else 0,
+            'dropped': self.queue_handler.dropped if self.queue_handler else 0,
+            'suppressed_repeats': self.rate_limit.suppressed_total,
+        }
+
+
+log_pipeline = LogPipeline()
+atexit.register(log_pipeline.stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=log_pipeline._after_fork)
+
+
+def setup_logging() -> None:
+    log_pipeline.setup()
+
+
+# ---------------------------------------------------------------------------
+# Thay thế print trong app.py
+# ---------------------------------------------------------------------------
+
+_ERROR_MARKS = ('❌', '🚨', '💥', '[CRITICAL')
+_WARNING_MARKS = ('⚠',)
+# Tag (chữ hoa) trong 80 ký tự đầu -> phân hệ
+_SUBSYSTEM_TAGS = (
+    ('SHEET', sheets_log), ('GOOGLE', sheets_log), ('TOKEN', sheets_log),
+    ('LICENSE', license_log), ('ACTIVAT', license_log),
+    ('CHATBOT', chatbot_log), ('OLLAMA', chatbot_log), ('LLM', chatbot_log),
+    ('APPROV', approval_log), ('PHÊ DUYỆT', approval_log),
+    ('EXPORT', export_log), ('EXCEL', export_log), ('PDF', export_log),
+)
+
+
+def level_for_message(text: str) -> int:
+    head = text.lstrip()[:12]
+    if head.startswith(_ERROR_MARKS) or 'Lỗi' in head[:5]:
+        return logging.ERROR
+    if head.startswith(_WARNING_MARKS):
+        return logging.WARNING
+    return logging.INFO
+
+
+def logger_for_message(text: str) -> logging.Logger:
+    head = text[:80].upper()
+    for tag, logger in _SUBSYSTEM_TAGS:
+        if tag in head:
+            return logger
+    return app_log
+
+
+def log_print(*args, sep=' ', end='\n', file=None, flush=False):
+    """Tương thích chữ ký print(); không flush, không chặn, bỏ qua dòng trống / dòng kẻ"""
+    if not args:
+        return
+    first = args[0] if isinstance(args[0], str) else str(args[0])
+    level = level_for_message(first)
+    logger = logger_for_message(first)
+    if not logger.isEnabledFor(level):
+        return
+    text = first if len(args) == 1 else sep.join([first] + [str(a) for a in args[1:]])
+    text = text.strip('\n')
+    if not text.strip(' =-─'):
+        return
+    # Không truyền args: '%' trong nội dung giữ nguyên, và mỗi dòng là 1 khoá giới hạn lặp riêng
+    logger.log(level, text)
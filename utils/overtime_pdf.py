@@ -0,0 +1,720 @@
+"""
+Vẽ giấy tăng ca (PDF) - create_overtime_pdf và các hàm vẽ chữ ký / font dùng chung
+
+Tách khỏi app.py để process render của export hàng loạt (utils/overtime_pdf_bulk.py, spawn)
+chỉ import module này: không chạy lại phần khởi tạo của app.py (DB, outbox, logging...) trong mỗi worker.
+Key giải mã chữ ký được truyền qua initializer của pool (init_render_worker), không qua biến môi trường.
+"""
+import base64
+
+from utils.lazy_imports import lazy
+from utils.log_pipeline import export_log, log_print
+from utils.signature_image_cache import signature_content_key, signature_image_cache
+from utils.signature_manager import signature_manager
+
+# reportlab - nạp lười như app.py; A4 import trong từng hàm vẽ PDF
+canvas = lazy('reportlab.pdfgen.canvas')
+ImageReader = lazy('reportlab.lib.utils', 'ImageReader')
+TTFont = lazy('reportlab.pdfbase.ttfonts', 'TTFont')
+colors = lazy('reportlab.lib.colors')
+Table = lazy('reportlab.platypus', 'Table')
+TableStyle = lazy('reportlab.platypus', 'TableStyle')
+Paragraph = lazy('reportlab.platypus', 'Paragraph')
+ParagraphStyle = lazy('reportlab.lib.styles', 'ParagraphStyle')
+registerFont = lazy('reportlab.pdfbase.pdfmetrics', 'registerFont')
+
+print = log_print
+
+# Cache fonts để tránh đăng ký lại mỗi lần
+_fonts_registered = False
+
+def register_pdf_fonts():
+    """Đăng ký fonts cho PDF một lần duy nhất"""
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    
+    try:
+        # Thử đăng ký DejaVuSans cho tiếng Việt
+        registerFont(TTFont('DejaVuSans', 'static/fonts/DejaVuSans.ttf'))
+        registerFont(TTFont('DejaVuSans-Bold', 'static/fonts/DejaVuSans.ttf'))  # Sử dụng cùng font cho bold
+        
+        # Đăng ký NotoSansJP cho tiếng Nhật
+        registerFont(TTFont('NotoSansJP', 'static/fonts/NotoSansJP-Regular.ttf'))
+        registerFont(TTFont('NotoSansJP-Bold', 'static/fonts/NotoSansJP-Bold.ttf'))
+        registerFont(TTFont('NotoSansJP-Medium', 'static/fonts/NotoSansJP-Medium.ttf'))
+        registerFont(TTFont('NotoSansJP-Light', 'static/fonts/NotoSansJP-Light.ttf'))
+        registerFont(TTFont('NotoSansJP-Black', 'static/fonts/NotoSansJP-Black.ttf'))
+        registerFont(TTFont('NotoSansJP-ExtraBold', 'static/fonts/NotoSansJP-ExtraBold.ttf'))
+        registerFont(TTFont('NotoSansJP-ExtraLight', 'static/fonts/NotoSansJP-ExtraLight.ttf'))
+        registerFont(TTFont('NotoSansJP-SemiBold', 'static/fonts/NotoSansJP-SemiBold.ttf'))
+        registerFont(TTFont('NotoSansJP-Thin', 'static/fonts/NotoSansJP-Thin.ttf'))
+        
+        _fonts_registered = True
+        print('PDF fonts registered successfully')
+    except Exception as e:
+        print('PDF font register error:', e)
+        # Fallback: sử dụng font mặc định
+        _fonts_registered = True
+
+# Hàm wrap_text cho phần ghi chú (đặt phía trên đoạn sử dụng)
+def wrap_text(text, font_name, font_size, max_width, canvas_obj):
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    words = text.split(' ')
+    lines = []
+    current_line = ''
+    for word in words:
+        test_line = current_line + (' ' if current_line else '') + word
+        if stringWidth(test_line, font_name, font_size) <= max_width:
+            current_line = test_line
+        else:
+            if current_line:
+                lines.append(current_line)
+            current_line = word
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+# Thêm hàm debug chữ ký
+def debug_signature_data(signature_data, source="unknown"):
+    """Debug chi tiết dữ liệu chữ ký"""
+    print(f"=== DEBUG SIGNATURE DATA ({source}) ===")
+    if not signature_data:
+        print("Signature data is None or empty")
+        return
+    
+    print(f"Type: {type(signature_data)}")
+    print(f"Length: {len(signature_data)}")
+    
+    if isinstance(signature_data, str):
+        print(f"Starts with 'data:image': {signature_data.startswith('data:image')}")
+        print(f"First 100 chars: {signature_data[:100]}")
+        print(f"Last 100 chars: {signature_data[-100:]}")
+        
+        # Kiểm tra có phải base64 không
+        try:
+            decoded = base64.b64decode(signature_data)
+            print(f"Valid base64: Yes, decoded length: {len(decoded)}")
+        except Exception:
+            print("Valid base64: No")
+            
+            # Thử giải mã nếu có thể
+            try:
+                decrypted = signature_manager.decrypt_signature(signature_data)
+                if decrypted:
+                    print(f"Decrypted successfully, length: {len(decrypted)}")
+                    print(f"Decrypted starts with 'data:image': {decrypted.startswith('data:image')}")
+                else:
+                    print("Decryption failed or returned empty")
+            except Exception as e:
+                print(f"Decryption error: {e}")
+    
+    print("=== END DEBUG ===")
+
+def _prepare_signature_image(signature_data, box_width, box_height):
+    """
+    Chuẩn bị ảnh chữ ký để vẽ vào ô box_width x box_height (fit + resize 300 DPI + màu bút bi).
+    Trả về (ImageReader, draw_width, draw_height, img_width, img_height) hoặc None nếu lỗi.
+    """
+    try:
+        # Sử dụng signature fit adapter để điều chỉnh chữ ký vừa khít với ô
+        from utils.signature_manager import signature_manager
+        
+        # Xác định loại ô dựa trên kích thước
+        box_type = 'default'
+        if box_width >= 140 and box_height >= 70:
+            box_type = 'manager'  # Ô quản lý
+        elif box_width >= 120 and box_height >= 60:
+            box_type = 'supervisor'  # Ô cấp trên
+        elif box_width >= 100 and box_height >= 50:
+            box_type = 'applicant'  # Ô người xin phép
+        
+        print(f"DEBUG: Using signature fit adapter for box type: {box_type}")
+        
+        # Điều chỉnh chữ ký vừa khít với ô
+        fitted_signature = signature_manager.fit_signature_to_form_box(
+            signature_data, 
+            box_type=box_type
+        )
+        
+        if not fitted_signature:
+            print("DEBUG: Failed to fit signature to box")
+            return None
+                
+        print(f"DEBUG: Fitted signature length: {len(fitted_signature)}")
+        
+        # Decode base64
+        try:
+            if fitted_signature.startswith('data:image'):
+                fitted_signature = fitted_signature.split(',')[1]
+            
+            decoded_data = base64.b64decode(fitted_signature)
+            print(f"DEBUG: Successfully decoded fitted signature, length: {len(decoded_data)}")
+            
+        except Exception as decode_error:
+            print(f"DEBUG: Failed to decode fitted signature: {decode_error}")
+            return None
+        
+        # Mở và chuẩn hóa ảnh, đồng thời chuẩn bị để nội suy theo kích thước vẽ thực tế
+        try:
+            from PIL import Image
+            import io
+            
+            pil_image = Image.open(io.BytesIO(decoded_data))
+            if pil_image.mode != 'RGBA':
+                pil_image = pil_image.convert('RGBA')
+        except Exception as img_open_err:
+            print(f"DEBUG: Failed to open image for processing: {img_open_err}")
+            return None
+        
+        # Tính tỷ lệ để giữ nguyên tỷ lệ khung hình và vừa khít với ô
+        img_width, img_height = pil_image.size
+        print(f"DEBUG: Fitted image size (PIL): {img_width}x{img_height}")
+        aspect_ratio = img_width / img_height
+        box_aspect_ratio = box_width / box_height
+        
+        # Tính kích thước thực tế để vẽ - TĂNG FILL RATIO ĐỂ CHỮ KÝ LỚN HƠN KHI IN
+        # Điều chỉnh động dựa trên kích thước chữ ký gốc
+        fill_ratio = 0.96  # Tăng từ 92% lên 96% để chữ ký lớn hơn khi in
+        
+        # Kiểm tra kích thước chữ ký đã được fit
+        # Nếu chữ ký đã được fit đúng kích thước ô, sử dụng trực tiếp
+        if abs(img_width - box_width) < box_width * 0.1 and abs(img_height - box_height) < box_height * 0.1:
+            # Chữ ký đã được fit gần đúng kích thước ô, sử dụng fill_ratio
+            draw_width = box_width * fill_ratio
+            draw_height = box_height * fill_ratio
+        else:
+            # Chữ ký chưa được fit, tính toán lại để fill tốt
+            if aspect_ratio > box_aspect_ratio:
+                # Ảnh rộng hơn, căn theo chiều rộng
+                draw_width = box_width * fill_ratio
+                draw_height = draw_width / aspect_ratio
+            else:
+                # Ảnh cao hơn, căn theo chiều cao
+                draw_height = box_height * fill_ratio
+                draw_width = draw_height * aspect_ratio
+            
+            # Đảm bảo không vượt quá kích thước ô
+            if draw_width > box_width:
+                draw_width = box_width * fill_ratio
+                draw_height = draw_width / aspect_ratio
+            if draw_height > box_height:
+                draw_height = box_height * fill_ratio
+                draw_width = draw_height * aspect_ratio
+            
+            # Đảm bảo fill tối thiểu 80% nếu chữ ký quá nhỏ
+            min_fill = 0.80
+            if draw_width < box_width * min_fill or draw_height < box_height * min_fill:
+                # Scale lên để đạt min_fill
+                width_scale = (box_width * min_fill) / draw_width if draw_width < box_width * min_fill else 1.0
+                height_scale = (box_height * min_fill) / draw_height if draw_height < box_height * min_fill else 1.0
+                scale_factor = min(width_scale, height_scale)
+                draw_width = draw_width * scale_factor
+                draw_height = draw_height * scale_factor
+                
+                # Đảm bảo không vượt quá fill_ratio sau khi scale
+                if draw_width > box_width * fill_ratio:
+                    draw_width = box_width * fill_ratio
+                    draw_height = draw_width / aspect_ratio
+                if draw_height > box_height * fill_ratio:
+                    draw_height = box_height * fill_ratio
+                    draw_width = draw_height * aspect_ratio
+        
+        # Kiểm tra kích thước vẽ hợp lệ
+        if draw_width <= 0 or draw_height <= 0:
+            print(f"DEBUG: Invalid draw dimensions: {draw_width}x{draw_height}")
+            return None
+        
+        # Nội suy ảnh tới độ phân giải mục tiêu dựa trên kích thước vẽ để luôn sắc nét
+        try:
+            target_dpi = 300  # Tăng từ 220 lên 300 DPI để chữ ký sắc nét hơn khi in
+            target_px_w = max(1, int(draw_width * target_dpi / 72.0))
+            target_px_h = max(1, int(draw_height * target_dpi / 72.0))
+            
+            if pil_image.size != (target_px_w, target_px_h):
+                pil_image = pil_image.resize((target_px_w, target_px_h), Image.Resampling.LANCZOS)
+            
+            # Chuyển màu chữ ký sang xanh bút bi sau khi đã resize để giữ cạnh mịn
+            data = pil_image.getdata()
+            blue_pen_color = (0, 0, 255, 255)
+            new_data = []
+            for item in data:
+                if item[0] < 50 and item[1] < 50 and item[2] < 50 and item[3] > 100:
+                    new_data.append(blue_pen_color)
+                else:
+                    new_data.append(item)
+            new_image = Image.new('RGBA', pil_image.size)
+            new_image.putdata(new_data)
+            
+            new_image_buffer = io.BytesIO()
+            new_image.save(new_image_buffer, format='PNG')
+            new_image_buffer.seek(0)
+            img = ImageReader(new_image_buffer)
+            print("DEBUG: Image prepared and ImageReader created at target DPI")
+        except Exception as prep_err:
+            print(f"DEBUG: Failed to prepare high-DPI image: {prep_err}")
+            try:
+                img = ImageReader(io.BytesIO(decoded_data))
+            except Exception:
+                return None
+        
+        # Đọc sẵn dữ liệu ảnh để ImageReader dùng chung an toàn giữa nhiều PDF/thread
+        img.getRGBData()
+        return img, draw_width, draw_height, img_width, img_height
+        
+    except Exception as e:
+        print(f"DEBUG: Error preparing signature with signature fit adapter: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def draw_signature_with_proper_scaling(canvas, signature_data, x, y, box_width, box_height):
+    """
+    Vẽ chữ ký với tỷ lệ đúng và màu xanh như bút bi - SỬ DỤNG SIGNATURE FIT ADAPTER
+    Ảnh đã xử lý được cache theo nội dung chữ ký + kích thước ô (signature_image_cache)
+    """
+    if not signature_data:
+        print("DEBUG: No signature data provided to draw")
+        return False
+    
+    try:
+        prepared = signature_image_cache.get_or_create(
+            signature_content_key(signature_data, box_width, box_height),
+            lambda: _prepare_signature_image(signature_data, box_width, box_height)
+        )
+        if not prepared:
+            return False
+        img, draw_width, draw_height, img_width, img_height = prepared
+        
+        # Tính vị trí căn giữa
+        x_offset = (box_width - draw_width) / 2
+        y_offset = (box_height - draw_height) / 2
+        
+        # Vẽ nền trắng cho ô chữ ký để tránh bị đen
+        canvas.setFillColor(colors.white)
+        canvas.rect(x, y, box_width, box_height, fill=1, stroke=0)
+        canvas.setFillColor(colors.black)  # Reset về màu đen cho text
+        
+        # Vẽ chữ ký với kích thước đã tính toán
+        try:
+            final_x = x + x_offset
+            final_y = y + y_offset
+            
+            # Kiểm tra vị trí hợp lệ
+            if final_x < 0 or final_y < 0:
+                print(f"DEBUG: Invalid position: ({final_x}, {final_y})")
+                return False
+                
+            # Kiểm tra vị trí có vượt quá trang không
+            if final_x + draw_width > canvas._pagesize[0] or final_y + draw_height > canvas._pagesize[1]:
+                print(f"DEBUG: Position out of page bounds")
+                return False
+            
+            canvas.drawImage(img, final_x, final_y, width=draw_width, height=draw_height)
+            print(f"DEBUG: Blue signature drawn successfully with signature fit adapter")
+            print(f"DEBUG: Fitted size: {img_width}x{img_height}, Draw size: {draw_width:.1f}x{draw_height:.1f}")
+            print(f"DEBUG: Position: ({final_x:.1f}, {final_y:.1f})")
+            return True
+        except Exception as draw_error:
+            print(f"DEBUG: Failed to draw image: {draw_error}")
+            import traceback
+            traceback.print_exc()
+            return False
+        
+    except Exception as e:
+        print(f"DEBUG: Error drawing signature with signature fit adapter: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def create_signature_placeholder(canvas, x, y, box_width, box_height, text="Chữ ký"):
+    """Tạo placeholder cho chữ ký khi không thể hiển thị"""
+    try:
+        # Vẽ nền trắng
+        canvas.setFillColor(colors.white)
+        canvas.rect(x, y, box_width, box_height, fill=1, stroke=0)
+        
+        # Vẽ border
+        canvas.setStrokeColor(colors.grey)
+        canvas.setLineWidth(0.5)
+        canvas.rect(x, y, box_width, box_height, stroke=1, fill=0)
+        
+        # Vẽ text placeholder
+        canvas.setFillColor(colors.grey)
+        canvas.setFont("DejaVuSans", 8)
+        
+        # Căn giữa text
+        text_width = canvas.stringWidth(text, "DejaVuSans", 8)
+        text_x = x + (box_width - text_width) / 2
+        text_y = y + box_height / 2 + 3  # +3 để căn giữa theo chiều dọc
+        
+        canvas.drawString(text_x, text_y, text)
+        
+        # Reset màu
+        canvas.setFillColor(colors.black)
+        canvas.setStrokeColor(colors.black)
+        
+        return True
+    except Exception as e:
+        print(f"DEBUG: Error creating signature placeholder: {e}")
+        return False
+
+def create_overtime_pdf(attendance, buffer):
+    """Tạo PDF giấy tăng ca cho một bản ghi attendance"""
+    from reportlab.lib.pagesizes import A4
+    # Đăng ký fonts một lần duy nhất
+    register_pdf_fonts()
+    
+    user = attendance.user
+    employee_signature = attendance.signature if attendance.signature else None
+    team_leader_signature = attendance.team_leader_signature if attendance.team_leader_signature else None
+    manager_signature = attendance.manager_signature if attendance.manager_signature else None
+    
+    # Lấy thông tin người ký từ database
+    from database.models import User, db
+    
+    # Thông tin người ký employee (người tạo đơn)
+    employee_signer_name = user.name if user else "Không xác định"
+    
+    # Thông tin người ký team leader và manager - load relationship và xử lý an toàn
+    team_leader_signer_name = "Chưa ký"
+    manager_signer_name = "Chưa ký"
+    
+    # Kiểm tra và lấy tên người ký team leader
+    if hasattr(attendance, 'team_leader_signer') and attendance.team_leader_signer:
+        team_leader_signer_name = attendance.team_leader_signer.name
+    elif hasattr(attendance, 'team_leader_signer_id') and attendance.team_leader_signer_id:
+        # Nếu có ID nhưng relationship chưa load, query trực tiếp
+        team_leader = db.session.get(User, attendance.team_leader_signer_id)
+        if team_leader:
+            team_leader_signer_name = team_leader.name
+    
+    # Kiểm tra và lấy tên người ký manager
+    if hasattr(attendance, 'manager_signer') and attendance.manager_signer:
+        manager_signer_name = attendance.manager_signer.name
+    elif hasattr(attendance, 'manager_signer_id') and attendance.manager_signer_id:
+        # Nếu có ID nhưng relationship chưa load, query trực tiếp
+        manager = db.session.get(User, attendance.manager_signer_id)
+        if manager:
+            manager_signer_name = manager.name
+    
+
+
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    margin = 30
+    y = height - margin
+
+    # Header: Bảng 6 cột như trong hình
+    header_data = [
+        [
+            Paragraph('<b>DMI HUẾ</b>', ParagraphStyle('h', fontName='DejaVuSans', fontSize=9, alignment=1)),
+            Paragraph('<b>総務<br/>TỔNG VỤ</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=8, alignment=1)),
+            Paragraph('<b>分類番号：<br/>Số hiệu phân loại：</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=7, alignment=1)),
+            Paragraph('', ParagraphStyle('h', fontName='DejaVuSans', fontSize=8, alignment=1)),  # Ô trắng sau ô 3
+            Paragraph('<b>記入 FORM<br/>NHẬP FORM</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=8, alignment=1)),
+            Paragraph('<b>Form作成：<br/>Tác thành：</b>', ParagraphStyle('h', fontName='NotoSansJP', fontSize=7, alignment=1)),
+            Paragraph('', ParagraphStyle('h', fontName='DejaVuSans', fontSize=8, alignment=1)),  # Ô trắng sau ô tác thành
+            Paragraph('', ParagraphStyle('h', fontName='DejaVuSans', fontSize=8, alignment=1)),  # Ô trắng thứ 2 sau ô tác thành
+        ]
+    ]
+    
+    col_widths = [60, 80, 100, 50, 80, 80, 50, 50]  # Tổng = 570, gần bằng width A4
+    header_table_width = sum(col_widths)
+    x_header = (width - header_table_width) / 2
+    header_table = Table(header_data, colWidths=col_widths, rowHeights=25)
+    header_table.setStyle(TableStyle([
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('BOX', (0,0), (-1,-1), 0.5, colors.black),
+        ('INNERGRID', (0,0), (-1,-1), 0.5, colors.black),
+        ('FONTNAME', (0,0), (-1,-1), 'DejaVuSans'),
+    ]))
+    header_table.wrapOn(c, width-2*margin, 30)
+    header_table.drawOn(c, x_header, y-25)
+    y -= 40
+
+    # Thông tin công ty
+    c.setFont("DejaVuSans", 10)
+    c.drawString(margin, y, "Công ty TNHH DMI HUẾ")
+    y -= 12
+    c.setFont("DejaVuSans", 8)
+    c.drawString(margin, y, "174 Bà Triệu- tòa nhà 4 tầng Phong Phú Plaza, phường Phú Hội, Thành phố Huế, Tỉnh Thừa Thiên Huế,Việt Nam.")
+    y -= 25
+
+    # Tiêu đề chính
+    c.setFont("DejaVuSans", 14)
+    c.drawCentredString(width/2, y, "GIẤY ĐỀ NGHỊ TĂNG CA/ĐI LÀM NGÀY NGHỈ")
+    y -= 16
+    c.setFont("NotoSansJP", 11)
+    c.drawCentredString(width/2, y, "(残業/休日出勤申請書)")
+    y -= 20
+    c.setFont("DejaVuSans", 9)
+    c.drawCentredString(width/2, y, "Nộp tại bộ phận tổng vụ")
+    c.setFont("NotoSansJP-Light", 9)
+    c.drawCentredString(width/2, y-10, "(総務部署で提出)")
+    y -= 30
+
+    # Phần checkbox và thông tin cá nhân
+    c.setFont("DejaVuSans", 10)
+    
+    # Dòng checkbox
+    checkbox_y = y
+    c.rect(margin, checkbox_y-3, 8, 8)  # Checkbox tăng ca
+    c.drawString(margin+15, checkbox_y, "Tăng ca /")
+    c.setFont("NotoSansJP", 10)
+    c.drawString(margin+70, checkbox_y, "残業")
+    
+    c.rect(margin+200, checkbox_y-3, 8, 8)  # Checkbox đi làm ngày nghỉ
+    c.setFont("DejaVuSans", 10)
+    c.drawString(margin+215, checkbox_y, "Đi làm ngày nghỉ /")
+    c.setFont("NotoSansJP", 10)
+    c.drawString(margin+320, checkbox_y, "休日出勤")
+    y -= 20
+
+    # Thông tin nhân viên
+    c.setFont("NotoSansJP-Light", 10)
+    c.drawString(margin, y, f"Họ tên (氏名)：{user.name}")
+    c.drawString(margin+200, y, f"Nhóm (チーム)：{user.department}")
+    c.drawString(margin+350, y, f"Mã NV (社員コード): {user.employee_id}")
+    y -= 15
+    
+    c.drawString(margin, y, f"Lý do tăng ca (理由): {attendance.note}")
+    y -= 15
+    
+    c.drawString(margin, y, "Đề nghị công ty chấp thuận cho tôi được tăng ca/đi làm vào ngày nghỉ.")
+    y -= 10
+    c.setFont("NotoSansJP-Light", 9)
+    c.drawString(margin, y, "残業/休日出勤を許可お願いします。")
+    y -= 25
+    
+    # Thêm khoảng cách trước khi vẽ bảng thời gian
+    y -= 15
+
+    # Bảng chấm công chi tiết
+    table_y = y
+    table_width = width - 2*margin
+    
+    # Định nghĩa style cho tiêu đề
+    header_style_vn = ParagraphStyle('header_vn', fontName='DejaVuSans', fontSize=8, alignment=1)
+    header_style_jp = ParagraphStyle('header_jp', fontName='NotoSansJP', fontSize=8, alignment=1)
+    
+    # Tạo chuỗi thời gian làm việc
+    time_str = f"{attendance.check_in.strftime('%H:%M') if attendance.check_in else '-'} - {attendance.check_out.strftime('%H:%M') if attendance.check_out else '-'}"
+    
+    # Xác định hình thức (1 hoặc 2)
+    holiday_type = getattr(attendance, 'holiday_type', None)
+    special_day_types = {'weekend', 'vietnamese_holiday', 'japanese_holiday'}
+    form_type = "2" if holiday_type in special_day_types else "1"
+    
+    # Hàng 1: Tiếng Việt
+    header_row1 = [
+        Paragraph('No.', header_style_vn),
+        Paragraph('NGÀY THÁNG NĂM', header_style_vn),
+        Paragraph('HÌNH THỨC', header_style_vn),
+        Paragraph('CA LÀM VIỆC', header_style_vn),
+        Paragraph('GIỜ VÀO - GIỜ RA', header_style_vn),
+        Paragraph('Thời gian nghỉ đối ứng công việc', header_style_vn),
+        Paragraph('XÁC NHẬN', header_style_vn)
+    ]
+    # Hàng 2: Tiếng Nhật/Hán
+    header_row2 = [
+        Paragraph('', header_style_jp),
+        Paragraph('日付', header_style_jp),
+        Paragraph('種類', header_style_jp),
+        Paragraph('シフト', header_style_jp),
+        Paragraph('出勤時間-退勤時間', header_style_jp),
+        Paragraph('業務対応時間', header_style_jp),
+        Paragraph('ラボマネ承認', header_style_jp)
+    ]
+    # Hàng dữ liệu
+    # Tách riêng thời gian và đối ứng để dễ đọc
+    time_info = f"{attendance.check_in.strftime('%H:%M') if attendance.check_in else '-'} - {attendance.check_out.strftime('%H:%M') if attendance.check_out else '-'}"
+    
+    # Tính tổng thời gian đối ứng - chỉ hiển thị 1 giá trị duy nhất
+    total_comp_time = 0.0
+    
+    # Cộng tất cả các loại đối ứng - SỬ DỤNG CỘT MINUTES MỚI
+    total_comp_minutes = 0
+    total_comp_minutes += attendance.comp_time_regular_minutes or 0
+    total_comp_minutes += attendance.comp_time_overtime_minutes or 0
+    total_comp_minutes += attendance.comp_time_ot_before_22_minutes or 0
+    total_comp_minutes += attendance.comp_time_ot_after_22_minutes or 0
+    total_comp_minutes += attendance.overtime_comp_time_minutes or 0
+    
+    total_comp_time = total_comp_minutes / 60.0
+    
+    # Định dạng tổng thời gian đối ứng
+    if total_comp_time > 0:
+        comp_time_display = attendance._format_hours_minutes(total_comp_time)
+    else:
+        comp_time_display = "0:00"
+    
+    # Tạo dữ liệu hàng với thông tin rõ ràng
+    row_data = [
+        '1',
+        attendance.date.strftime('%d/%m/%Y'),
+        form_type,
+        attendance.shift_code or '-',
+        time_info,
+        comp_time_display,  # Chỉ hiển thị 1 giá trị tổng thời gian đối ứng
+        ''
+    ]
+    
+    table_data = [header_row1, header_row2, row_data]
+    col_widths = [30, 80, 50, 65, 80, 110, 70]  # Tổng nhỏ hơn width, luôn còn margin hai bên
+    row_heights = [40, 14, 18]  # Hàng dữ liệu bình thường vì chỉ hiển thị 1 giá trị
+    
+    detail_table_width = sum(col_widths)
+    x_detail = (width - detail_table_width) / 2
+    table = Table(table_data, colWidths=col_widths, rowHeights=row_heights)
+    table.setStyle(TableStyle([
+        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('BOX', (0,0), (-1,-1), 0.5, colors.black),
+        ('INNERGRID', (0,0), (-1,-1), 0.5, colors.black),
+        ('FONTNAME', (0,0), (-1,0), 'DejaVuSans'),
+        ('FONTNAME', (0,1), (-1,1), 'NotoSansJP'),
+        ('FONTSIZE', (0,0), (-1,1), 8),
+        ('FONTSIZE', (0,2), (-1,2), 9),
+        # Xóa dòng kẻ ngang giữa hàng 0 và 1
+        ('LINEBELOW', (0,0), (-1,0), 0, colors.white),
+    ]))
+    table.wrapOn(c, width-2*margin, 50)
+    table.drawOn(c, x_detail, table_y - 46)
+    y = table_y - 46 - 36  # cập nhật y cho phần tiếp theo
+    
+    # Ghi chú dưới bảng
+    note_sections = [
+        ("DejaVuSans", 8, "* Ghi chú: Tại cột Hình thức: Tăng ca ngày bình thường ghi số 1 Đi làm ngày nghỉ, tăng ca ghi số 2"),
+        ("NotoSansJP-Light", 8, "備考：平日の残業の場合：1番を記入してください。 休日出勤の場合：2番を記入してください。"),
+        ("DejaVuSans", 8, "*Về việc nghỉ giải lao (60 phút) ngày thường trong tuần, trường hợp nếu nghỉ dài hơn vì đối ứng công việc ：Hãy nộp đơn cho bộ phận văn phòng."),
+        ("NotoSansJP-Light", 8, "通常（1の場合）の昼休憩（60分）に、休憩途中で業務対応する場合、申請をして下さい。"),
+        ("DejaVuSans", 8, "*Trong trường hợp không xin phép trước, thì tăng ca và đi làm ngày nghỉ không được chấp nhận."),
+        ("DejaVuSans", 8, "Phải ghi giấy tăng ca sau khi tăng ca (chậm nhất là ngày mai) ,sang ngày mốt ghi tăng ca thì không được chấp nhận."),
+        ("NotoSansJP-Light", 8, "※1分単位で申請して下さい。申請をしない限り、残業と休日出勤は反映されません。"),
+        ("NotoSansJP-Light", 8, "必ず、残業をした日に申請すること。（次の日までの申請は認めますが、それ以外の申請は認めません）")
+    ]
+    max_note_width = width - 2*margin - 10
+    for i, (font_name, font_size, text) in enumerate(note_sections):
+        lines = wrap_text(text, font_name, font_size, max_note_width, c)
+        for line in lines:
+            c.setFont(font_name, font_size)
+            c.drawString(margin, y, line)
+            y -= font_size + 1
+        # Thêm dòng trắng sau mỗi đoạn bắt đầu bằng * (trừ đoạn cuối)
+        if text.startswith('*') and i < len(note_sections)-1:
+            y -= font_size + 1
+    
+    # Thêm khoảng cách giữa phần ghi chú và dòng ngày tháng
+    y -= 25
+    # Ngày tháng - Đặt ở vị trí cao hơn để không bị đè
+    date_y = y + 20  # Đặt dòng ngày tháng cao hơn
+    c.setFont("DejaVuSans", 10)
+    c.drawRightString(width-margin, date_y, f"Huế, ngày {attendance.date.day} tháng {attendance.date.month} năm {attendance.date.year}")
+    y -= 10  # Đẩy dòng ngày tháng xuống thấp hơn
+    y -= 95  # Tăng thêm khoảng cách để không bị đè lên phần ghi chú và dòng ngày tháng
+    
+    # --- Căn chỉnh lại phần chữ ký và tiêu đề phía trên ---
+    # Số ô và kích thước - TĂNG KÍCH THƯỚC Ô ĐỂ CHỮ KÝ LỚN HƠN KHI IN
+    num_boxes = 3
+    box_width = 170  # Tăng từ 140 lên 170 để chữ ký lớn hơn khi in
+    box_height = 90  # Tăng từ 70 lên 90 để có nhiều không gian cho chữ ký
+    box_spacing = 20  # Giảm khoảng cách để 3 ô vẫn vừa trang
+    total_width = num_boxes * box_width + (num_boxes - 1) * box_spacing
+    start_x = (width - total_width) / 2
+    box_y = y  # y là vị trí đáy các ô
+    label_font_size = 10
+    sublabel_font_size = 8
+    # Tiêu đề các ô
+    box_titles = [
+        ("Quản lí", "ラボマネジャー"),
+        ("Cấp trên trực tiếp", "□室長　□リーダー　□他"),
+        ("Người xin phép", "申請者")
+    ]
+    # Vẽ tiêu đề và sublabel căn giữa trên mỗi ô
+    for i, (title, sublabel) in enumerate(box_titles):
+        x = start_x + i * (box_width + box_spacing)
+        # Căn giữa tiêu đề
+        c.setFont("DejaVuSans", label_font_size)
+        c.drawCentredString(x + box_width/2, box_y + box_height + 22, title)
+        c.setFont("NotoSansJP-Light", sublabel_font_size)
+        c.drawCentredString(x + box_width/2, box_y + box_height + 10, sublabel)
+    # Vẽ các ô chữ ký với border - SẼ ĐƯỢC VẼ LẠI SAU KHI VẼ CHỮ KÝ
+    signature_boxes = []
+    for i in range(num_boxes):
+        x = start_x + i * (box_width + box_spacing)
+        signature_boxes.append((x, box_y, box_width, box_height))
+    # Hiển thị chữ ký hoặc (chưa ký) căn giữa trong từng ô
+    # Quản lý
+    x0 = start_x
+    signature_area_height = box_height - 20  # Tăng vùng chữ ký để chữ ký lớn hơn khi in
+    signature_y = box_y + 20  # Chữ ký ở phần trên (cách đáy 20px)
+    signature_center_y = signature_y + signature_area_height/2 - 8/2  # Căn giữa chữ ký
+    name_y = box_y + 8  # Tên người ký ở phần dưới (cách đáy 8px)
+    
+    if manager_signature:
+        export_log.debug("DEBUG: Processing manager signature for PDF")
+        debug_signature_data(manager_signature, "manager")
+        success = draw_signature_with_proper_scaling(c, manager_signature, x0, signature_y, box_width, signature_area_height)
+        if not success:
+            export_log.debug("DEBUG: Failed to draw manager signature, creating placeholder")
+            create_signature_placeholder(c, x0, signature_y, box_width, signature_area_height, "Lỗi hiển thị")
+    else:
+        c.setFont("DejaVuSans", 8)
+        c.drawCentredString(x0 + box_width/2, signature_center_y, "(chưa ký)")
+    
+    # Thêm tên người ký quản lý bên trong ô chữ ký (phía dưới chữ ký)
+    c.setFont("DejaVuSans", 8)
+    c.drawCentredString(x0 + box_width/2, name_y, manager_signer_name)
+    
+    # Trưởng nhóm
+    x1 = start_x + 1 * (box_width + box_spacing)
+    
+    if team_leader_signature:
+        export_log.debug("DEBUG: Processing team leader signature for PDF")
+        debug_signature_data(team_leader_signature, "team_leader")
+        success = draw_signature_with_proper_scaling(c, team_leader_signature, x1, signature_y, box_width, signature_area_height)
+        if not success:
+            export_log.debug("DEBUG: Failed to draw team leader signature, creating placeholder")
+            create_signature_placeholder(c, x1, signature_y, box_width, signature_area_height, "Lỗi hiển thị")
+    else:
+        c.setFont("DejaVuSans", 8)
+        c.drawCentredString(x1 + box_width/2, signature_center_y, "(chưa ký)")
+    
+    # Thêm tên người ký trưởng nhóm bên trong ô chữ ký (phía dưới chữ ký)
+    c.setFont("DejaVuSans", 8)
+    c.drawCentredString(x1 + box_width/2, name_y, team_leader_signer_name)
+    
+    # Nhân viên
+    x2 = start_x + 2 * (box_width + box_spacing)
+    
+    if employee_signature:
+        export_log.debug("DEBUG: Processing employee signature for PDF")
+        debug_signature_data(employee_signature, "employee")
+        success = draw_signature_with_proper_scaling(c, employee_signature, x2, signature_y, box_width, signature_area_height)
+        if not success:
+            export_log.debug("DEBUG: Failed to draw employee signature, creating placeholder")
+            create_signature_placeholder(c, x2, signature_y, box_width, signature_area_height, "Lỗi hiển thị")
+    else:
+        c.setFont("DejaVuSans", 8)
+        c.drawCentredString(x2 + box_width/2, signature_center_y, "(chưa ký)")
+    
+    # Thêm tên người ký nhân viên bên trong ô chữ ký (phía dưới chữ ký)
+    c.setFont("DejaVuSans", 8)
+    c.drawCentredString(x2 + box_width/2, name_y, employee_signer_name)
+    
+    # Vẽ lại border cho tất cả các ô chữ ký sau khi đã vẽ chữ ký
+    c.setStrokeColor(colors.black)
+    c.setLineWidth(0.5)
+    for x, y, w, h in signature_boxes:
+        c.rect(x, y, w, h, stroke=1, fill=0)
+    
+    c.save()
+
+
+def init_render_worker(signature_secret_key=None):
+    """Initializer của process render PDF: key giải mã chữ ký nhận qua tham số, đăng ký font 1 lần"""
+    if signature_secret_key:
+        signature_manager.init_cipher(signature_secret_key)
+    register_pdf_fonts()
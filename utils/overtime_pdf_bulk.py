@@ -0,0 +1,259 @@
+"""
+Render hàng loạt giấy tăng ca (PDF) cho export ZIP
+
+    - Chia việc render (create_overtime_pdf) cho process pool, pool được dùng lại giữa các lần export
+    - Cache PDF trên đĩa theo (attendance id, version, updated_at) -> lần xuất sau chỉ render bản ghi đã thay đổi
+    - Ghi ZIP dạng stream với ZIP_STORED (PDF đã nén sẵn), không giữ toàn bộ PDF trong RAM
+"""
+import glob
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OVERTIME_PDF_CACHE_DIR = os.environ.get('OVERTIME_PDF_CACHE_DIR', os.path.join('cache', 'overtime_pdf'))
+# <= 1: render ngay trong process hiện tại (không dùng pool)
+OVERTIME_PDF_WORKERS = int(os.environ.get('OVERTIME_PDF_WORKERS', max(1, min(4, (os.cpu_count() or 2) - 1))))
+# Tăng số này khi đổi layout giấy tăng ca để bỏ qua toàn bộ cache cũ
+OVERTIME_PDF_TEMPLATE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class BulkPdfEntry:
+    """1 file PDF trong ZIP: bản ghi chấm công + tên file trong ZIP"""
+    attendance_id: int
+    version: Optional[int]
+    updated_at: Optional[datetime]
+    arcname: str
+
+    @property
+    def cache_name(self) -> str:
+        stamp = self.updated_at.strftime('%Y%m%d%H%M%S%f') if self.updated_at else '0'
+        return f"{self.attendance_id}_v{self.version or 0}_{stamp}_t{OVERTIME_PDF_TEMPLATE_VERSION}.pdf"
+
+
+class OvertimePdfCache:
+    """Cache PDF trên đĩa; mỗi bản ghi chỉ giữ bản render mới nhất"""
+
+    def __init__(self, cache_dir: str = OVERTIME_PDF_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, entry: BulkPdfEntry) -> str:
+        return os.path.join(self.cache_dir, entry.cache_name)
+
+    def get(self, entry: BulkPdfEntry) -> Optional[str]:
+        path = self.path_for(entry)
+        return path if os.path.exists(path) else None
+
+    def store(self, entry: BulkPdfEntry, data: bytes) -> str:
+        path = self.path_for(entry)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # Xoá các bản render cũ (version/updated_at trước đó) của cùng bản ghi
+        for stale in glob.glob(os.path.join(self.cache_dir, f"{entry.attendance_id}_v*.pdf")):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        return path
+
+
+# ---------------------------------------------------------------------- #
+# Phía worker process
+# ---------------------------------------------------------------------- #
+_worker_render_func = None
+
+
+def _init_worker(render_func, initializer, initargs):
+    global _worker_render_func
+    _worker_render_func = render_func
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _render_in_worker(record) -> bytes:
+    buffer = io.BytesIO()
+    _worker_render_func(record, buffer)
+    return buffer.getvalue()
+
+
+class BulkPdfRenderer:
+    """
+    Render PDF hàng loạt qua process pool + cache đĩa.
+
+    render_func(record, buffer) phải là hàm cấp module (pickle được) và record phải
+    pickle được (ORM object đã nạp sẵn các quan hệ cần dùng và đã expunge khỏi session).
+    Worker spawn import module chứa render_func -> đặt nó trong module nhẹ, không import app.
+    initializer(*initargs) chạy 1 lần trong mỗi worker (vd: truyền key giải mã chữ ký, không qua env).
+    """
+
+    def __init__(self, render_func: Callable, cache: Optional[OvertimePdfCache] = None,
+                 max_workers: int = OVERTIME_PDF_WORKERS, initializer: Optional[Callable] = None,
+                 initargs: tuple = ()):
+        self.render_func = render_func
+        self.initializer = initializer
+        self.initargs = initargs
+        self.cache = cache or OvertimePdfCache()
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {'cache_hits': 0, 'rendered': 0, 'failed': 0}
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # spawn: không fork process Flask đang có nhiều thread/kết nối DB
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.render_func, self.initializer, self.initargs),
+                )
+                logger.info(f"Khởi động pool render PDF tăng ca với {self.max_workers} process")
+            return self._executor
+
+    def _discard_executor(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _render_inline(self, record) -> bytes:
+        buffer = io.BytesIO()
+        self.render_func(record, buffer)
+        return buffer.getvalue()
+
+    def _submit(self, record) -> Future:
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                return executor.submit(_render_in_worker, record)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning(f"Pool render PDF lỗi, chuyển sang render tuần tự: {e}")
+                self._discard_executor()
+                self.max_workers = 1
+        future = Future()
+        try:
+            future.set_result(self._render_inline(record))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _submit_batch(self, batch: List[BulkPdfEntry],
+                      load_records: Callable[[List[int]], Dict[int, object]]) -> List[Tuple]:
+        miss_ids = [entry.attendance_id for entry in batch if self.cache.get(entry) is None]
+        records = load_records(miss_ids) if miss_ids else {}
+        submitted = []
+        for entry in batch:
+            record = records.get(entry.attendance_id)
+            if record is not None:
+                submitted.append((entry, record, self._submit(record)))
+            else:
+                submitted.append((entry, None, None))
+        return submitted
+
+    def _collect_batch(self, submitted: List[Tuple]) -> Iterator[Tuple[BulkPdfEntry, Optional[str]]]:
+        for entry, record, future in submitted:
+            if future is None:
+                path = self.cache.get(entry)
+                if path:
+                    self._stats['cache_hits'] += 1
+                else:
+                    self._stats['failed'] += 1
+                yield entry, path
+                continue
+            try:
+                data = future.result()
+            except Exception as e:
+                # Worker lỗi (vd: cần truy vấn DB) -> render lại ngay trong process hiện tại
+                logger.warning(f"Render PDF tăng ca {entry.attendance_id} trong worker lỗi: {e}")
+                if isinstance(e, BrokenProcessPool):
+                    self._discard_executor()
+                try:
+                    data = self._render_inline(record)
+                except Exception as inline_error:
+                    logger.error(f"Không thể tạo PDF tăng ca {entry.attendance_id}: {inline_error}")
+                    self._stats['failed'] += 1
+                    yield entry, None
+                    continue
+            self._stats['rendered'] += 1
+            yield entry, self.cache.store(entry, data)
+
+    def iter_rendered(self, entries: Iterable[BulkPdfEntry],
+                      load_records: Callable[[List[int]], Dict[int, object]],
+                      batch_size: Optional[int] = None) -> Iterator[Tuple[BulkPdfEntry, Optional[str]]]:
+        """
+        Sinh (entry, đường dẫn PDF) theo đúng thứ tự entries; path None = không tạo được PDF.
+
+        load_records(ids) -> {attendance_id: record}: chỉ được gọi cho bản ghi chưa có trong cache,
+        theo từng lô batch_size. Lô kế tiếp được gửi vào pool trước khi trả kết quả lô hiện tại.
+        """
+        batch_size = batch_size or max(8, self.max_workers * 4)
+        pending = deque()
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                pending.append(self._submit_batch(batch, load_records))
+                batch = []
+                if len(pending) > 1:
+                    yield from self._collect_batch(pending.popleft())
+        if batch:
+            pending.append(self._submit_batch(batch, load_records))
+        while pending:
+            yield from self._collect_batch(pending.popleft())
+
+    def stats(self) -> dict:
+        return dict(self._stats, max_workers=self.max_workers, cache_dir=self.cache.cache_dir)
+
+
+class _ZipStreamSink:
+    """File-like chỉ ghi (không seek) để zipfile ghi ZIP dạng stream"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Ghi ZIP từ các cặp (tên trong ZIP, đường dẫn file) và sinh từng khối bytes.
+    Dùng ZIP_STORED: PDF đã nén sẵn, nén lại chỉ tốn CPU mà gần như không nhỏ hơn.
+    """
+    sink = _ZipStreamSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+        for arcname, path in files:
+            zipf.write(path, arcname)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
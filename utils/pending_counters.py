@@ -0,0 +1,311 @@
+"""
+Bộ đếm chờ phê duyệt giữ trong process (badge / pending-count / freshness)
+
+Trước đây mỗi lần client poll badge là 1 câu COUNT (join users, upper(trim(department)) không dùng
+được index), /api/attendance/pending còn chạy thêm 2 COUNT trên created_at / approved_at (không index).
+
+    - Đếm theo (loại, status, phòng ban) cho attendance / leave ở các trạng thái pending*
+      (phòng ban chuẩn hoá như User.department_key, chỉ user chưa xoá) + tổng theo (loại, status) cho mọi user
+    - Cập nhật tăng dần từ event của session SQLAlchemy: thêm / sửa status (attendance: cả approved,
+      cùng điều kiện approved == False với đối soát) / xoá bản ghi được gom
+      trong after_flush và chỉ áp dụng sau commit (rollback thì bỏ) - nên record_attendance,
+      approve_attendance, duyệt / từ chối đơn nghỉ... không cần gọi gì thêm
+    - UPDATE / DELETE hàng loạt (approve_all_*, xoá dữ liệu) và đổi phòng ban / xoá user
+      -> đánh dấu cần đối soát; đối soát = 1 GROUP BY / loại, chạy khi đọc nếu đã quá
+      PENDING_COUNTERS_RECONCILE_SECONDS giây (cũng là độ trễ tối đa giữa các worker)
+    - Freshness (nộp trong 5 phút / duyệt trong 2 phút) đọc từ danh sách thời điểm giữ trong RAM
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event, func, inspect as sa_inspect
+from sqlalchemy.orm.attributes import NO_VALUE
+
+from database.models import normalize_department
+
+logger = logging.getLogger(__name__)
+
+PENDING_COUNTERS_RECONCILE_SECONDS = int(os.environ.get('PENDING_COUNTERS_RECONCILE_SECONDS', 30))
+
+ATTENDANCE = 'attendance'
+LEAVE = 'leave'
+PENDING_STATUSES = ('pending', 'pending_manager', 'pending_admin')
+
+# Cửa sổ của check_data_freshness
+SUBMISSION_WINDOW = timedelta(minutes=5)
+APPROVAL_WINDOW = timedelta(minutes=2)
+
+_SESSION_KEY = 'pending_counter_changes'
+
+
+class PendingCounters:
+    """Bộ đếm thread-safe; gắn vào session bằng attach(), đối soát bằng query trên models"""
+
+    def __init__(self, reconcile_seconds: int = PENDING_COUNTERS_RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self._models = None
+        self._session = None
+        self._lock = threading.Lock()
+        self._by_department: Dict[Tuple[str, str, str], int] = {}
+        self._totals: Dict[Tuple[str, str], int] = {}
+        self._users: Dict[int, Tuple[str, bool]] = {}  # user_id -> (phòng ban chuẩn hoá, chưa xoá)
+        self._submissions: deque = deque()  # Attendance.created_at
+        self._approvals: deque = deque()  # Attendance.approved_at
+        self._reconciled_at = 0.0
+        self._stale_reason: Optional[str] = 'chưa nạp'
+        self._reconciles = 0
+        self._applied = 0
+        self._drift = 0
+
+    # ------------------------------------------------------------------
+    # Gắn vào session
+    # ------------------------------------------------------------------
+
+    def attach(self, session, user_model, attendance_model, leave_model) -> None:
+        """Nghe event của session (db.session) để cập nhật bộ đếm sau mỗi commit"""
+        self._models = (user_model, attendance_model, leave_model)
+        self._session = session
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_rollback', self._after_rollback)
+        event.listen(session, 'do_orm_execute', self._on_orm_execute)
+
+    def _changes(self, session) -> dict:
+        return session.info.setdefault(_SESSION_KEY, {'deltas': [], 'submitted': [], 'approved': [], 'stale': None})
+
+    def _kind(self, obj) -> Optional[str]:
+        _, attendance_model, leave_model = self._models
+        if isinstance(obj, attendance_model):
+            return ATTENDANCE
+        if isinstance(obj, leave_model):
+            return LEAVE
+        return None
+
+    @staticmethod
+    def _counted(kind: str, status, approved) -> bool:
+        """Cùng điều kiện với reconcile(): status pending*, attendance còn phải approved == False"""
+        return status in PENDING_STATUSES and (kind != ATTENDANCE or (approved is not None and not approved))
+
+    @staticmethod
+    def _before(state, key: str, current):
+        """
+        (biết được?, giá trị trước flush) của 1 thuộc tính. Gán lên bản ghi đã hết hạn (sau commit)
+        mà chưa đọc thì SQLAlchemy không nạp giá trị cũ -> không biết
+        """
+        if key not in state.committed_state:
+            return True, current
+        old = state.committed_state[key]
+        if old is NO_VALUE:
+            return False, None
+        return True, old
+
+    def _after_flush(self, session, flush_context) -> None:
+        user_model = self._models[0]
+        changes = self._changes(session)
+        for obj in session.new:
+            kind = self._kind(obj)
+            if kind is None:
+                continue
+            if self._counted(kind, obj.status, getattr(obj, 'approved', None)):
+                changes['deltas'].append((kind, obj.user_id, obj.status, 1))
+            if kind == ATTENDANCE:
+                if obj.created_at is not None:
+                    changes['submitted'].append(obj.created_at)
+                if obj.approved_at is not None:
+                    changes['approved'].append(obj.approved_at)
+        for obj in session.dirty:
+            if isinstance(obj, user_model):
+                state = sa_inspect(obj)
+                if state.attrs.department.history.has_changes() or state.attrs.is_deleted.history.has_changes():
+                    changes['stale'] = 'đổi phòng ban / xoá user'
+                continue
+            kind = self._kind(obj)
+            if kind is None:
+                continue
+            state = sa_inspect(obj)
+            if state.attrs.user_id.history.has_changes():
+                changes['stale'] = 'đổi user_id'
+                continue
+            changed = state.attrs.status.history.has_changes()
+            if kind == ATTENDANCE:
+                changed = changed or state.attrs.approved.history.has_changes()
+            if changed:
+                approved = obj.approved if kind == ATTENDANCE else None
+                known_status, old_status = self._before(state, 'status', obj.status)
+                known_approved, old_approved = self._before(state, 'approved', approved) if kind == ATTENDANCE else (True, None)
+                if not (known_status and known_approved):
+                    changes['stale'] = 'không rõ status / approved cũ'
+                    continue
+                if self._counted(kind, old_status, old_approved):
+                    changes['deltas'].append((kind, obj.user_id, old_status, -1))
+                if self._counted(kind, obj.status, approved):
+                    changes['deltas'].append((kind, obj.user_id, obj.status, 1))
+            if kind == ATTENDANCE and obj.approved_at is not None and state.attrs.approved_at.history.added:
+                changes['approved'].append(obj.approved_at)
+        for obj in session.deleted:
+            if isinstance(obj, user_model):
+                changes['stale'] = 'xoá user'
+                continue
+            kind = self._kind(obj)
+            if kind is None:
+                continue
+            state = sa_inspect(obj)
+            history = state.attrs.status.history
+            status = history.deleted[0] if history.deleted else obj.status
+            approved = None
+            if kind == ATTENDANCE:
+                approved_history = state.attrs.approved.history
+                approved = approved_history.deleted[0] if approved_history.deleted else obj.approved
+            if self._counted(kind, status, approved):
+                changes['deltas'].append((kind, obj.user_id, status, -1))
+
+    def _on_orm_execute(self, orm_execute_state) -> None:
+        # UPDATE / DELETE hàng loạt không đi qua flush -> đối soát lại sau commit
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in self._models:
+            self._changes(orm_execute_state.session)['stale'] = f'cập nhật hàng loạt {mapper.class_.__tablename__}'
+
+    def _after_commit(self, session) -> None:
+        changes = session.info.pop(_SESSION_KEY, None)
+        if changes:
+            self._apply(changes)
+
+    def _after_rollback(self, session) -> None:
+        session.info.pop(_SESSION_KEY, None)
+
+    def _apply(self, changes: dict) -> None:
+        with self._lock:
+            if changes['stale']:
+                self._stale_reason = changes['stale']
+            if self._stale_reason:
+                # Lần đọc tới sẽ đối soát lại toàn bộ
+                return
+            for kind, user_id, status, delta in changes['deltas']:
+                user = self._users.get(user_id)
+                if user is None:
+                    self._stale_reason = f'user {user_id} mới'
+                    return
+                department, active = user
+                self._totals[(kind, status)] = self._totals.get((kind, status), 0) + delta
+                if active:
+                    key = (kind, status, department)
+                    self._by_department[key] = self._by_department.get(key, 0) + delta
+                self._applied += 1
+            self._submissions.extend(changes['submitted'])
+            self._approvals.extend(changes['approved'])
+
+    # ------------------------------------------------------------------
+    # Đối soát
+    # ------------------------------------------------------------------
+
+    def mark_stale(self, reason: str = 'mark_stale') -> None:
+        with self._lock:
+            self._stale_reason = reason
+
+    def _ensure_fresh(self) -> None:
+        if self._stale_reason is None and time.monotonic() - self._reconciled_at < self.reconcile_seconds:
+            return
+        self.reconcile()
+
+    def reconcile(self) -> None:
+        """Đếm lại từ DB (GROUP BY) và thay toàn bộ bộ đếm"""
+        if self._models is None:
+            raise RuntimeError('PendingCounters chưa attach()')
+        session = self._session
+        user_model, attendance_model, leave_model = self._models
+        applied_before = self._applied
+        users = {row.id: (normalize_department(row.department), not row.is_deleted)
+                 for row in session.query(user_model.id, user_model.department, user_model.is_deleted)}
+        rows = []
+        for kind, model, extra in ((ATTENDANCE, attendance_model, (attendance_model.approved == False,)),  # noqa: E712
+                                   (LEAVE, leave_model, ())):
+            query = (session.query(model.user_id, model.status, func.count(model.id))
+                     .filter(model.status.in_(PENDING_STATUSES), *extra)
+                     .group_by(model.user_id, model.status))
+            rows.extend((kind, user_id, status, count) for user_id, status, count in query)
+
+        now = datetime.now()
+        submissions = [value for (value,) in session.query(attendance_model.created_at)
+                       .filter(attendance_model.created_at >= now - SUBMISSION_WINDOW)]
+        approvals = [value for (value,) in session.query(attendance_model.approved_at)
+                     .filter(attendance_model.approved_at >= now - APPROVAL_WINDOW)]
+
+        totals: Dict[Tuple[str, str], int] = {}
+        by_department: Dict[Tuple[str, str, str], int] = {}
+        for kind, user_id, status, count in rows:
+            totals[(kind, status)] = totals.get((kind, status), 0) + count
+            department, active = users.get(user_id, ('', False))
+            if active:
+                key = (kind, status, department)
+                by_department[key] = by_department.get(key, 0) + count
+
+        with self._lock:
+            if self._reconciles and self._stale_reason is None:
+                self._drift += sum(abs(totals.get(k, 0) - self._totals.get(k, 0)) for k in set(totals) | set(self._totals))
+            self._users = users
+            self._totals = totals
+            self._by_department = by_department
+            self._submissions = deque(sorted(submissions))
+            self._approvals = deque(sorted(approvals))
+            self._reconciled_at = time.monotonic()
+            # Có commit áp dụng vào bộ đếm cũ trong lúc query -> đối soát lại ở lần đọc sau
+            self._stale_reason = 'ghi trong lúc đối soát' if self._applied != applied_before else None
+            self._reconciles += 1
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+
+    def count(self, kind: str, status: str, department: Optional[str] = None) -> int:
+        """
+        department=None: mọi bản ghi ở status này (kể cả user đã xoá);
+        có department: chỉ user chưa xoá thuộc phòng ban đó (so sánh không phân biệt hoa thường / khoảng trắng)
+        """
+        self._ensure_fresh()
+        if department is None:
+            return max(self._totals.get((kind, status), 0), 0)
+        return max(self._by_department.get((kind, status, normalize_department(department)), 0), 0)
+
+    @staticmethod
+    def _recent(times: deque, window: timedelta, now: datetime) -> int:
+        threshold = now - window
+        while times and times[0] < threshold:
+            times.popleft()
+        return sum(1 for value in times if value >= threshold)
+
+    def freshness(self) -> dict:
+        """Cùng định dạng check_data_freshness"""
+        self._ensure_fresh()
+        now = datetime.now()
+        with self._lock:
+            recent_submissions = self._recent(self._submissions, SUBMISSION_WINDOW, now)
+            recent_approvals = self._recent(self._approvals, APPROVAL_WINDOW, now)
+        return {
+            'needs_refresh': recent_submissions > 0 or recent_approvals > 0,
+            'recent_submissions': recent_submissions,
+            'recent_approvals': recent_approvals,
+            'last_check': now.isoformat(),
+        }
+
+    def stats(self) -> dict:
+        return {
+            'totals': {f'{kind}:{status}': count for (kind, status), count in sorted(self._totals.items())},
+            'departments': len({key[2] for key in self._by_department}),
+            'age_seconds': round(time.monotonic() - self._reconciled_at, 1) if self._reconciles else None,
+            'stale_reason': self._stale_reason,
+            'reconciles': self._reconciles,
+            'applied_changes': self._applied,
+            'drift_corrected': self._drift,
+            'reconcile_seconds': self.reconcile_seconds,
+        }
+
+
+# Global instance - attach trong app.py
+pending_counters = PendingCounters()
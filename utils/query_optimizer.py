@@ -3,18 +3,156 @@ Query optimization utilities for fastest database operations
 """
 from functools import wraps
 from flask import current_app
-from sqlalchemy.orm import joinedload, selectinload, load_only
-from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import joinedload, selectinload, load_only, defer, with_expression
+from sqlalchemy import event, func, and_, or_
 from database.models import db, Attendance, User, Request, LeaveRequest
+from datetime import date
+import base64
+import json
+import threading
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-def optimize_attendance_history_query(search=None, department=None, date_from=None, date_to=None, 
-                                    user_id=None, page=1, per_page=20, is_admin=False):
+# Cache tổng số bản ghi theo chữ ký bộ lọc (chế độ cursor) - tránh COUNT lại mỗi lần lật trang
+COUNT_CACHE_TTL = 30  # giây
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+def encode_cursor(att_date, att_id, direction='next'):
+    """Tạo cursor (opaque) từ khóa sắp xếp (date, id) của bản ghi"""
+    payload = json.dumps({'d': att_date.isoformat(), 'i': att_id, 'dir': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Giải mã cursor -> (date, id, direction). Raise ValueError nếu cursor không hợp lệ"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        direction = payload.get('dir', 'next')
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return date.fromisoformat(payload['d']), int(payload['i']), direction
+    except Exception as e:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}") from e
+
+def _cached_count(q, signature):
+    """COUNT có cache theo chữ ký bộ lọc trong COUNT_CACHE_TTL giây"""
+    now = time.time()
+    with _count_cache_lock:
+        cached = _count_cache.get(signature)
+        if cached and now - cached[0] < COUNT_CACHE_TTL:
+            return cached[1]
+    total = q.count()
+    with _count_cache_lock:
+        # Dọn các entry hết hạn để cache không phình
+        for key in [k for k, (ts, _) in _count_cache.items() if now - ts >= COUNT_CACHE_TTL]:
+            del _count_cache[key]
+        _count_cache[signature] = (now, total)
+    return total
+
+def invalidate_count_cache():
+    """Xoá cache tổng số (tự gọi sau mỗi commit có ghi Attendance / User - xem attach_count_cache_invalidation)"""
+    with _count_cache_lock:
+        _count_cache.clear()
+
+_COUNT_CACHE_SESSION_KEY = 'count_cache_dirty'
+
+def attach_count_cache_invalidation(session):
     """
-    Optimized attendance history query with minimal database hits
+    Nghe event của session (db.session): commit nào có ghi Attendance / User (duyệt, từ chối, gửi đơn,
+    xoá, đổi phòng ban, kể cả UPDATE hàng loạt) thì xoá cache tổng số -> không phục vụ số cũ tới COUNT_CACHE_TTL
+    """
+    event.listen(session, 'after_flush', _mark_count_cache_dirty)
+    event.listen(session, 'do_orm_execute', _mark_count_cache_dirty_bulk)
+    event.listen(session, 'after_commit', _invalidate_count_cache_after_commit)
+    event.listen(session, 'after_rollback', _discard_count_cache_mark)
+
+def _mark_count_cache_dirty(session, flush_context):
+    if any(isinstance(obj, (Attendance, User)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_COUNT_CACHE_SESSION_KEY] = True
+
+def _mark_count_cache_dirty_bulk(orm_execute_state):
+    # UPDATE / DELETE hàng loạt không đi qua flush
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in (Attendance, User):
+        orm_execute_state.session.info[_COUNT_CACHE_SESSION_KEY] = True
+
+def _invalidate_count_cache_after_commit(session):
+    if session.info.pop(_COUNT_CACHE_SESSION_KEY, False):
+        invalidate_count_cache()
+
+def _discard_count_cache_mark(session):
+    session.info.pop(_COUNT_CACHE_SESSION_KEY, None)
+
+def _keyset_page(q, cursor, per_page):
+    """
+    Phân trang keyset theo (date DESC, id DESC) - dùng idx_attendance_date, không OFFSET.
+
+    Returns:
+        (records, page_info) với page_info = {'next_cursor', 'prev_cursor', 'has_more'}
+    """
+    direction = 'next'
+    if cursor:
+        cursor_date, cursor_id, direction = decode_cursor(cursor)
+        if direction == 'next':
+            q = q.filter(or_(
+                Attendance.date < cursor_date,
+                and_(Attendance.date == cursor_date, Attendance.id < cursor_id)
+            ))
+        else:
+            q = q.filter(or_(
+                Attendance.date > cursor_date,
+                and_(Attendance.date == cursor_date, Attendance.id > cursor_id)
+            ))
+
+    if direction == 'next':
+        q = q.order_by(Attendance.date.desc(), Attendance.id.desc())
+    else:
+        q = q.order_by(Attendance.date.asc(), Attendance.id.asc())
+
+    # Lấy dư 1 bản ghi để biết còn trang tiếp theo hay không
+    records = q.limit(per_page + 1).all()
+    has_more = len(records) > per_page
+    records = records[:per_page]
+    if direction == 'prev':
+        records.reverse()
+
+    if direction == 'next':
+        has_next, has_prev = has_more, bool(cursor)
+    else:
+        has_next, has_prev = True, has_more
+
+    page_info = {
+        'next_cursor': encode_cursor(records[-1].date, records[-1].id, 'next') if records and has_next else None,
+        'prev_cursor': encode_cursor(records[0].date, records[0].id, 'prev') if records and has_prev else None,
+        'has_more': has_next,
+    }
+    return records, page_info
+
+def signature_flag_options():
+    """
+    Query options cho chế độ danh sách: không đọc các cột chữ ký base64,
+    thay bằng cờ has_* tính trong SQL (Attendance.has_signature, ...)
+    """
+    options = []
+    for column_name in Attendance.SIGNATURE_COLUMNS:
+        column = getattr(Attendance, column_name)
+        options.append(defer(column))
+        options.append(with_expression(
+            getattr(Attendance, f"has_{column_name}"),
+            and_(column.isnot(None), column != '')
+        ))
+    return options
+
+def build_attendance_history_query(search=None, department=None, date_from=None, date_to=None,
+                                   user_id=None, is_admin=False):
+    """
+    Query lịch sử chấm công đã áp bộ lọc, CHƯA sắp xếp/phân trang.
+    Dùng chung cho API danh sách và export streaming (yield_per).
     """
     # Base query with optimized joins
     if is_admin:
@@ -54,9 +192,37 @@ def optimize_attendance_history_query(search=None, department=None, date_from=No
         q = q.filter(Attendance.date >= date_from)
     if date_to:
         q = q.filter(Attendance.date <= date_to)
+    return q
+
+def optimize_attendance_history_query(search=None, department=None, date_from=None, date_to=None, 
+                                    user_id=None, page=1, per_page=20, is_admin=False,
+                                    include_signatures=True, cursor=None, include_total=True):
+    """
+    Optimized attendance history query with minimal database hits
+
+    include_signatures=False: không nạp ảnh chữ ký (dùng với Attendance.to_dict(include_signatures=False))
+    cursor=None: phân trang page/offset, trả về (records, total)
+    cursor='' hoặc cursor từ lần trước: phân trang keyset, trả về (records, total, page_info);
+        total được cache theo bộ lọc, hoặc None nếu include_total=False
+    """
+    q = build_attendance_history_query(search=search, department=department, date_from=date_from,
+                                       date_to=date_to, user_id=user_id, is_admin=is_admin)
+    
+    if not include_signatures:
+        signature_q = q.options(*signature_flag_options())
+    else:
+        signature_q = q
+    
+    if cursor is not None:
+        filter_signature = ('history', is_admin, None if is_admin else user_id,
+                            search, department, str(date_from), str(date_to))
+        total = _cached_count(q, filter_signature) if include_total else None
+        records, page_info = _keyset_page(signature_q, cursor, per_page)
+        return records, total, page_info
     
     # Get total count efficiently (without loading data)
     total = q.count()
+    q = signature_q
     
     # Apply pagination and ordering
     records = q.order_by(Attendance.date.desc()).offset((page-1)*per_page).limit(per_page).all()
@@ -64,35 +230,18 @@ def optimize_attendance_history_query(search=None, department=None, date_from=No
     return records, total
 
 def optimize_pending_attendance_query(current_role, user, search=None, department=None, 
-                                    date_from=None, date_to=None, page=1, per_page=20):
+                                    date_from=None, date_to=None, page=1, per_page=20,
+                                    cursor=None, include_total=True):
     """
     Optimized pending attendance query with role-based optimization
+
+    cursor: như optimize_attendance_history_query - None = page/offset, còn lại = keyset
     """
     # Build query based on role
     if current_role == 'TEAM_LEADER':
-        # Pre-filter team users for better performance
-        # Sử dụng so sánh không phân biệt hoa thường để tránh lỗi matching
-        user_dept = (user.department or '').strip().upper()
-        
-        # Debug: đếm số nhân viên cùng phòng ban
-        team_count = db.session.query(func.count(User.id)).filter(
-            func.upper(func.trim(User.department)) == user_dept,
-            User.is_deleted == False
-        ).scalar()
-        print(f"🔍 [QUERY_OPT] TEAM_LEADER dept: [{user.department}] -> upper: [{user_dept}]", flush=True)
-        print(f"🔍 [QUERY_OPT] Found {team_count} users in same department", flush=True)
-        
-        # Debug: đếm tổng số pending attendance
-        total_pending = db.session.query(func.count(Attendance.id)).filter(
-            Attendance.approved == False,
-            Attendance.status == 'pending'
-        ).scalar()
-        print(f"🔍 [QUERY_OPT] Total pending attendance in DB: {total_pending}", flush=True)
-        
-        team_user_ids = db.session.query(User.id).filter(
-            func.upper(func.trim(User.department)) == user_dept,
-            User.is_deleted == False
-        ).scalar_subquery()
+        # Nhân viên cùng phòng ban qua idx_user_department_key (không phân biệt hoa thường)
+        team_user_ids = User.team_ids(user.department)
+        logger.debug("TEAM_LEADER pending query, department=%r", user.department)
         
         q = db.session.query(Attendance).filter(
             Attendance.approved == False,
@@ -136,6 +285,15 @@ def optimize_pending_attendance_query(current_role, user, search=None, departmen
     if date_to:
         q = q.filter(Attendance.date <= date_to)
     
+    if cursor is not None:
+        filter_signature = ('pending', current_role, user.id if current_role == 'TEAM_LEADER' else None,
+                            search, department, str(date_from), str(date_to))
+        total = _cached_count(q, filter_signature) if include_total else None
+        records, page_info = _keyset_page(q.options(
+            joinedload(Attendance.user).load_only(User.name, User.employee_id, User.department)
+        ), cursor, per_page)
+        return records, total, page_info
+    
     # Get count and records with eager loading
     total = q.count()
     records = q.options(
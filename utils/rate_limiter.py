@@ -0,0 +1,213 @@
+"""
+Rate limiter dạng sliding-window counter với storage thay thế được
+
+Thuật toán: mỗi key giữ bộ đếm của cửa sổ hiện tại và cửa sổ trước đó,
+số request ước lượng = prev * (phần còn lại của cửa sổ trước) + curr  -> O(1) mỗi request.
+
+Storage chọn theo RATELIMIT_STORAGE_URL:
+    - memory://            : trong process (dev / 1 worker)
+    - redis://host:6379/0  : dùng chung giữa các worker/máy (Lua script, atomic)
+    - sqlite:///path.db    : dùng chung giữa các worker trên cùng máy, không cần Redis
+Key không hoạt động tự hết hạn sau 2 cửa sổ. Mọi backend cùng một ngữ nghĩa.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _window_position(now: float, window_seconds: int) -> Tuple[int, float]:
+    """Trả về (chỉ số cửa sổ hiện tại, trọng số của cửa sổ trước)"""
+    window_idx = int(now // window_seconds)
+    elapsed_fraction = (now - window_idx * window_seconds) / window_seconds
+    return window_idx, 1.0 - elapsed_fraction
+
+
+def _retry_after(now: float, window_seconds: int) -> int:
+    return max(1, math.ceil(window_seconds - (now % window_seconds)))
+
+
+class MemoryRateLimitStorage:
+    """Bộ đếm trong process; dọn key không hoạt động định kỳ"""
+
+    SWEEP_INTERVAL = 60  # giây
+
+    def __init__(self):
+        # key -> [window_idx, window_seconds, curr, prev]
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.time() + self.SWEEP_INTERVAL
+
+    def hit(self, key: str, limit: int, window_seconds: int, now: Optional[float] = None) -> Tuple[bool, int]:
+        now = time.time() if now is None else now
+        window_idx, prev_weight = _window_position(now, window_seconds)
+        with self._lock:
+            entry = self._counters.get(key)
+            if entry is None or entry[0] < window_idx - 1:
+                curr, prev = 0, 0
+            elif entry[0] == window_idx - 1:
+                curr, prev = 0, entry[2]
+            else:
+                curr, prev = entry[2], entry[3]
+
+            allowed = prev * prev_weight + curr < limit
+            if allowed:
+                curr += 1
+            self._counters[key] = [window_idx, window_seconds, curr, prev]
+
+            if now >= self._next_sweep:
+                self._sweep(now)
+        return allowed, 0 if allowed else _retry_after(now, window_seconds)
+
+    def _sweep(self, now: float) -> None:
+        expired = [key for key, (idx, window, _, _) in self._counters.items() if idx < int(now // window) - 1]
+        for key in expired:
+            del self._counters[key]
+        self._next_sweep = now + self.SWEEP_INTERVAL
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class RedisRateLimitStorage:
+    """Bộ đếm trên Redis; kiểm tra + tăng trong 1 Lua script để atomic giữa các worker"""
+
+    _SCRIPT = """
+local curr = tonumber(redis.call('GET', KEYS[1]) or '0')
+local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+if prev * tonumber(ARGV[2]) + curr >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+    def __init__(self, url: str):
+        import redis  # Chỉ cần khi cấu hình Redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._client.ping()
+        self._script = self._client.register_script(self._SCRIPT)
+
+    def hit(self, key: str, limit: int, window_seconds: int, now: Optional[float] = None) -> Tuple[bool, int]:
+        now = time.time() if now is None else now
+        window_idx, prev_weight = _window_position(now, window_seconds)
+        allowed = bool(self._script(
+            keys=[f"rl:{key}:{window_idx}", f"rl:{key}:{window_idx - 1}"],
+            args=[limit, prev_weight, window_seconds * 2],
+        ))
+        return allowed, 0 if allowed else _retry_after(now, window_seconds)
+
+
+class SQLiteRateLimitStorage:
+    """Bộ đếm trong file SQLite riêng; các worker cùng máy dùng chung qua transaction IMMEDIATE"""
+
+    SWEEP_INTERVAL = 300  # giây
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_counters ("
+            " key TEXT PRIMARY KEY, window_idx INTEGER NOT NULL, curr INTEGER NOT NULL,"
+            " prev INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limit_expires ON rate_limit_counters (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key: str, limit: int, window_seconds: int, now: Optional[float] = None) -> Tuple[bool, int]:
+        now = time.time() if now is None else now
+        window_idx, prev_weight = _window_position(now, window_seconds)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT window_idx, curr, prev FROM rate_limit_counters WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] < window_idx - 1:
+                curr, prev = 0, 0
+            elif row[0] == window_idx - 1:
+                curr, prev = 0, row[1]
+            else:
+                curr, prev = row[1], row[2]
+
+            allowed = prev * prev_weight + curr < limit
+            if allowed:
+                curr += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit_counters (key, window_idx, curr, prev, expires_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, window_idx, curr, prev, (window_idx + 2) * window_seconds),
+            )
+            if now >= self._next_sweep:
+                conn.execute("DELETE FROM rate_limit_counters WHERE expires_at < ?", (now,))
+                self._next_sweep = now + self.SWEEP_INTERVAL
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0 if allowed else _retry_after(now, window_seconds)
+
+
+def create_rate_limit_storage(url: Optional[str]):
+    """Tạo storage theo URL; lỗi kết nối -> dùng bộ nhớ trong process (giới hạn theo từng worker)"""
+    url = (url or 'memory://').strip()
+    try:
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            return RedisRateLimitStorage(url)
+        if url.startswith('sqlite:///'):
+            return SQLiteRateLimitStorage(url[len('sqlite:///'):])
+        if not url.startswith('memory://'):
+            logger.warning(f"RATELIMIT_STORAGE_URL không hỗ trợ: {url}, dùng memory://")
+    except Exception as e:
+        logger.warning(f"Không kết nối được rate limit storage {url}: {e}. Dùng memory:// (giới hạn theo từng worker)")
+    return MemoryRateLimitStorage()
+
+
+class RateLimiter:
+    """Giữ storage theo URL cấu hình; tự chuyển sang bộ nhớ trong process nếu storage chung lỗi"""
+
+    def __init__(self):
+        self._storage = None
+        self._storage_url = None
+        self._fallback = MemoryRateLimitStorage()
+        self._lock = threading.Lock()
+
+    def _get_storage(self, url: Optional[str]):
+        with self._lock:
+            if self._storage is None or url != self._storage_url:
+                self._storage = create_rate_limit_storage(url)
+                self._storage_url = url
+            return self._storage
+
+    def hit(self, key: str, limit: int, window_seconds: int, storage_url: Optional[str] = None) -> Tuple[bool, int]:
+        """Ghi nhận 1 request. Trả về (được phép?, số giây nên chờ nếu bị chặn)"""
+        storage = self._get_storage(storage_url)
+        try:
+            return storage.hit(key, limit, window_seconds)
+        except Exception as e:
+            logger.warning(f"Rate limit storage lỗi ({e}), tạm dùng bộ nhớ trong process")
+            return self._fallback.hit(key, limit, window_seconds)
+
+
+# Global instance dùng cho decorator rate_limit
+rate_limiter = RateLimiter()
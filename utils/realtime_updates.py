@@ -2,16 +2,17 @@
 Real-time updates utilities for immediate data refresh
 """
 from flask import session, request
-from database.models import db, Attendance, User, LeaveRequest
+from database.models import db, Attendance, User
 from sqlalchemy import func
 import logging
 from datetime import datetime, timedelta
+from utils.pending_counters import ATTENDANCE, LEAVE, pending_counters
 
 logger = logging.getLogger(__name__)
 
 def get_realtime_pending_count(user_id, current_role):
     """
-    Get real-time pending count for current role
+    Get real-time pending count for current role (đọc từ pending_counters, không COUNT mỗi lần poll)
     """
     try:
         user = db.session.get(User, user_id)
@@ -19,42 +20,13 @@ def get_realtime_pending_count(user_id, current_role):
             return 0
         
         if current_role == 'TEAM_LEADER':
-            # Count team members' pending records
-            # Sử dụng so sánh không phân biệt hoa thường
-            user_dept = (user.department or '').strip().upper()
-            team_user_ids = db.session.query(User.id).filter(
-                func.upper(func.trim(User.department)) == user_dept,
-                User.is_deleted == False
-            ).scalar_subquery()
-            
-            count = db.session.query(func.count(Attendance.id)).filter(
-                Attendance.approved == False,
-                Attendance.status == 'pending',
-                Attendance.user_id.in_(team_user_ids)
-            ).scalar()
-            
+            # Team members' pending records (phòng ban không phân biệt hoa thường)
+            return pending_counters.count(ATTENDANCE, 'pending', user.department)
         elif current_role == 'MANAGER':
-            # Count department pending records
-            count = db.session.query(func.count(Attendance.id)).join(
-                Attendance.user
-            ).filter(
-                Attendance.approved == False,
-                Attendance.status == 'pending_manager',
-                User.department == user.department,
-                User.is_deleted == False
-            ).scalar()
-            
+            return pending_counters.count(ATTENDANCE, 'pending_manager', user.department)
         elif current_role == 'ADMIN':
-            # Count all pending records
-            count = db.session.query(func.count(Attendance.id)).filter(
-                Attendance.approved == False,
-                Attendance.status == 'pending_admin'
-            ).scalar()
-            
-        else:
-            count = 0
-            
-        return count or 0
+            return pending_counters.count(ATTENDANCE, 'pending_admin')
+        return 0
         
     except Exception as e:
         logger.error(f"Error getting realtime pending count: {e}")
@@ -62,7 +34,7 @@ def get_realtime_pending_count(user_id, current_role):
 
 def get_realtime_leave_pending_count(user_id, current_role):
     """
-    Get real-time pending leave requests count
+    Get real-time pending leave requests count (đọc từ pending_counters)
     """
     try:
         user = db.session.get(User, user_id)
@@ -70,35 +42,14 @@ def get_realtime_leave_pending_count(user_id, current_role):
             return 0
         
         if current_role == 'TEAM_LEADER':
-            # Count team members' pending leave requests
-            # Sử dụng so sánh không phân biệt hoa thường
-            user_dept = (user.department or '').strip().upper()
-            team_user_ids = db.session.query(User.id).filter(
-                func.upper(func.trim(User.department)) == user_dept,
-                User.is_deleted == False
-            ).scalar_subquery()
-            
-            count = db.session.query(func.count(LeaveRequest.id)).filter(
-                LeaveRequest.status == 'pending',
-                LeaveRequest.user_id.in_(team_user_ids)
-            ).scalar()
-            
+            return pending_counters.count(LEAVE, 'pending', user.department)
         elif current_role == 'MANAGER':
             # MANAGER đếm đơn pending_manager (đã được TEAM_LEADER phê duyệt)
-            count = db.session.query(func.count(LeaveRequest.id)).filter(
-                LeaveRequest.status == 'pending_manager'
-            ).scalar()
-            
+            return pending_counters.count(LEAVE, 'pending_manager')
         elif current_role == 'ADMIN':
             # ADMIN đếm đơn pending_admin (đã được MANAGER phê duyệt)
-            count = db.session.query(func.count(LeaveRequest.id)).filter(
-                LeaveRequest.status == 'pending_admin'
-            ).scalar()
-            
-        else:
-            count = 0
-            
-        return count or 0
+            return pending_counters.count(LEAVE, 'pending_admin')
+        return 0
         
     except Exception as e:
         logger.error(f"Error getting realtime leave pending count: {e}")
@@ -168,32 +119,10 @@ def get_fresh_attendance_data(user_id, current_role, filters=None):
 
 def check_data_freshness(user_id, current_role):
     """
-    Check if data needs refresh based on recent activity
+    Check if data needs refresh based on recent activity (nộp trong 5 phút / duyệt trong 2 phút)
     """
     try:
-        # Check for recent attendance submissions (last 5 minutes)
-        recent_threshold = datetime.now() - timedelta(minutes=5)
-        
-        recent_count = db.session.query(func.count(Attendance.id)).filter(
-            Attendance.created_at >= recent_threshold
-        ).scalar()
-        
-        # Check for recent approvals (last 2 minutes)
-        approval_threshold = datetime.now() - timedelta(minutes=2)
-        
-        recent_approvals = db.session.query(func.count(Attendance.id)).filter(
-            Attendance.approved_at >= approval_threshold
-        ).scalar()
-        
-        # Data needs refresh if there's recent activity
-        needs_refresh = (recent_count > 0) or (recent_approvals > 0)
-        
-        return {
-            'needs_refresh': needs_refresh,
-            'recent_submissions': recent_count or 0,
-            'recent_approvals': recent_approvals or 0,
-            'last_check': datetime.now().isoformat()
-        }
+        return pending_counters.freshness()
         
     except Exception as e:
         logger.error(f"Error checking data freshness: {e}")
@@ -0,0 +1,236 @@
+"""
+Bản sao chỉ đọc (read replica) của SQLite cho export / báo cáo nặng
+
+Export Excel, ZIP giấy tăng ca, kiểm tra dữ liệu tháng 12, lịch sử chấm công của admin đọc
+khoảng dữ liệu lớn; trên file chính, 1 transaction đọc dài làm checkpoint WAL bị dồn
+và chấm công / phê duyệt phải xếp hàng phía sau.
+
+    - Snapshot tạo bằng online backup API (sqlite3.Connection.backup), ghi file tạm rồi đổi tên
+      -> mỗi thế hệ snapshot là 1 file mới, không bao giờ bị sửa sau khi tạo
+    - Mở bằng URI mode=ro&immutable=1: không khoá, không đọc WAL/shm, không tranh chấp với file chính
+    - Làm mới nền (1 thread, không chặn request) khi snapshot cũ hơn REPORT_SNAPSHOT_MAX_AGE;
+      chưa có snapshot hoặc cũ hơn REPORT_SNAPSHOT_MAX_STALENESS -> đọc file chính như cũ
+    - Response mang header X-Data-Source / X-Data-Snapshot-At / X-Data-Staleness-Seconds
+
+Bật bằng REPORT_SNAPSHOT_ENABLED=1 (mặc định tắt: export đọc dữ liệu mới nhất như trước).
+"""
+import glob
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+REPORT_SNAPSHOT_ENABLED = os.environ.get('REPORT_SNAPSHOT_ENABLED', '0') == '1'
+REPORT_SNAPSHOT_DIR = os.environ.get('REPORT_SNAPSHOT_DIR', os.path.join('cache', 'report_snapshot'))
+# Cũ hơn mức này -> làm mới nền (vẫn phục vụ snapshot hiện tại trong lúc chờ)
+REPORT_SNAPSHOT_MAX_AGE = int(os.environ.get('REPORT_SNAPSHOT_MAX_AGE', 300))
+# Cũ hơn mức này -> không dùng snapshot, đọc file chính
+REPORT_SNAPSHOT_MAX_STALENESS = int(os.environ.get('REPORT_SNAPSHOT_MAX_STALENESS', 3600))
+
+_PREFIX = 'report_'
+
+
+def backup_sqlite_database(src: str, dst: str, pages_per_step: int = 1024) -> None:
+    """
+    Chụp bản sao nhất quán của SQLite bằng online backup API.
+    Sao chép từng nhóm page, nhả lock giữa các bước để không chặn request ghi;
+    ghi ra file tạm rồi đổi tên; lỗi giữa chừng thì xoá file tạm nên không để lại file dở dang.
+    """
+    tmp_dst = f"{dst}.part"
+    try:
+        src_conn = sqlite3.connect(src, timeout=30)
+        try:
+            dst_conn = sqlite3.connect(tmp_dst)
+            try:
+                src_conn.backup(dst_conn, pages=pages_per_step, sleep=0.01)
+            finally:
+                dst_conn.close()
+        finally:
+            src_conn.close()
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        try:
+            os.remove(tmp_dst)
+        except OSError:
+            pass
+        raise
+
+
+class _Generation:
+    """1 file snapshot + engine chỉ đọc của nó"""
+
+    def __init__(self, path: str, taken_at: datetime):
+        self.path = path
+        self.taken_at = taken_at
+        self.taken_monotonic = time.monotonic()
+        uri = f"{Path(path).resolve().as_uri()}?mode=ro&immutable=1"
+        self.engine = create_engine(
+            'sqlite://',
+            creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+            poolclass=QueuePool, pool_size=2, max_overflow=4,
+        )
+
+    @property
+    def age_seconds(self) -> float:
+        return time.monotonic() - self.taken_monotonic
+
+
+class ReportSession:
+    """
+    Session cho truy vấn báo cáo: snapshot nếu có, ngược lại là db.session (file chính).
+    Dùng query.with_session(report.session) để chạy query builder sẵn có trên snapshot.
+    """
+
+    def __init__(self, session, generation: Optional[_Generation]):
+        self.session = session
+        self._generation = generation
+        self._owns_session = generation is not None
+
+    @property
+    def source(self) -> str:
+        return 'snapshot' if self._generation else 'primary'
+
+    @property
+    def taken_at(self) -> Optional[datetime]:
+        return self._generation.taken_at if self._generation else None
+
+    @property
+    def staleness_seconds(self) -> int:
+        return int(self._generation.age_seconds) if self._generation else 0
+
+    def apply_headers(self, response):
+        """Gắn nguồn dữ liệu + độ cũ vào response để client biết số liệu chốt lúc nào"""
+        response.headers['X-Data-Source'] = self.source
+        if self._generation:
+            response.headers['X-Data-Snapshot-At'] = self._generation.taken_at.isoformat(timespec='seconds')
+            response.headers['X-Data-Staleness-Seconds'] = str(self.staleness_seconds)
+        return response
+
+    def close(self) -> None:
+        if self._owns_session:
+            self.session.close()
+            self._owns_session = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReportSnapshotManager:
+    """Giữ snapshot hiện tại, làm mới nền theo tuổi, dọn thế hệ cũ"""
+
+    def __init__(self, snapshot_dir: str = REPORT_SNAPSHOT_DIR, enabled: bool = REPORT_SNAPSHOT_ENABLED,
+                 max_age: int = REPORT_SNAPSHOT_MAX_AGE, max_staleness: int = REPORT_SNAPSHOT_MAX_STALENESS):
+        self.snapshot_dir = snapshot_dir
+        self.enabled = enabled
+        self.max_age = max_age
+        self.max_staleness = max_staleness
+        self._current: Optional[_Generation] = None
+        self._previous: Optional[_Generation] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._stats_lock = threading.Lock()
+        self._stats = {'snapshot_reads': 0, 'primary_reads': 0, 'refreshes': 0, 'refresh_errors': 0,
+                       'last_refresh_seconds': None}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        # Tăng từ thread request (open) lẫn thread làm mới snapshot -> cần khoá
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def refresh(self, source_path: str) -> _Generation:
+        """Chụp snapshot mới (đồng bộ) và chuyển các lần đọc sau sang nó"""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        taken_at = datetime.now()
+        path = os.path.join(self.snapshot_dir, f"{_PREFIX}{taken_at.strftime('%Y%m%d_%H%M%S_%f')}.db")
+        started = time.perf_counter()
+        backup_sqlite_database(source_path, path)
+        generation = _Generation(path, taken_at)
+        seconds = round(time.perf_counter() - started, 2)
+        with self._lock:
+            stale, self._previous, self._current = self._previous, self._current, generation
+        with self._stats_lock:
+            self._stats['refreshes'] += 1
+            self._stats['last_refresh_seconds'] = seconds
+        # Giữ lại thế hệ trước cho export đang chạy dở; thế hệ cũ hơn thì bỏ
+        if stale is not None:
+            stale.engine.dispose()
+        self._remove_old_files(keep={generation.path, self._previous.path if self._previous else None})
+        logger.info(f"Đã tạo snapshot báo cáo {path} ({seconds}s)")
+        return generation
+
+    def _remove_old_files(self, keep: set) -> None:
+        for path in glob.glob(os.path.join(self.snapshot_dir, f"{_PREFIX}*.db*")):
+            if path not in keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Windows: file còn đang được mở -> xoá ở lần làm mới sau
+                    pass
+
+    def _refresh_in_background(self, source_path: str) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def _run():
+            try:
+                self.refresh(source_path)
+            except Exception as e:
+                self._count('refresh_errors')
+                logger.warning(f"Không tạo được snapshot báo cáo: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=_run, name='report-snapshot', daemon=True).start()
+
+    def open(self, primary_session, source_path: Optional[str], fresh: bool = False) -> ReportSession:
+        """
+        Session cho 1 export/báo cáo.
+        fresh=True (vd: ?fresh=1) hoặc snapshot không dùng được -> db.session trên file chính.
+        """
+        if not self.enabled or fresh or not source_path:
+            self._count('primary_reads')
+            return ReportSession(primary_session, None)
+
+        generation = self._current
+        if generation is None or generation.age_seconds >= self.max_age:
+            self._refresh_in_background(source_path)
+        if generation is None or generation.age_seconds >= self.max_staleness:
+            self._count('primary_reads')
+            return ReportSession(primary_session, None)
+
+        self._count('snapshot_reads')
+        return ReportSession(Session(bind=generation.engine, autoflush=False), generation)
+
+    def stats(self) -> dict:
+        generation = self._current
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return dict(
+            counters,
+            enabled=self.enabled,
+            refreshing=self._refreshing,
+            snapshot_at=generation.taken_at.isoformat(timespec='seconds') if generation else None,
+            staleness_seconds=int(generation.age_seconds) if generation else None,
+            max_age=self.max_age,
+            max_staleness=self.max_staleness,
+        )
+
+
+# Global instance dùng cho các export/báo cáo trong app.py
+report_snapshot = ReportSnapshotManager()
@@ -1,10 +1,14 @@
 """
 Session management utilities for the attendance management system
 """
+import os
 from datetime import datetime, timedelta, time
 from flask import request, session
 from database.models import db, AuditLog
 
+# last_activity chỉ ghi lại khi đã cũ hơn chừng này giây: session không đổi -> không phải ghi lại store / cookie
+SESSION_ACTIVITY_WRITE_SECONDS = int(os.environ.get('SESSION_ACTIVITY_WRITE_SECONDS', 30))
+
 def check_session_timeout():
     """Check if session has timed out"""
     if 'last_activity' in session:
@@ -16,7 +20,15 @@ def check_session_timeout():
 
 def update_session_activity():
     """Update last activity time in session"""
-    session['last_activity'] = datetime.now().isoformat()
+    now = datetime.now()
+    last_activity = session.get('last_activity')
+    if last_activity:
+        try:
+            if (now - datetime.fromisoformat(last_activity)).total_seconds() < SESSION_ACTIVITY_WRITE_SECONDS:
+                return
+        except ValueError:
+            pass
+    session['last_activity'] = now.isoformat()
 
 def log_audit_action(user_id, action, table_name, record_id=None, old_values=None, new_values=None):
     """Log audit action to database"""
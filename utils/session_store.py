@@ -0,0 +1,274 @@
+"""
+Session phía server: cookie chỉ chứa session id, dữ liệu nằm trong SQLite / Redis
+
+Với session cookie mặc định của Flask, toàn bộ session (kể cả chữ ký mã hoá Fernet dạng base64
+mà SignatureManager.save_signature_to_session lưu) đi kèm MỌI request và được ký + serialize lại
+ở MỌI response (SESSION_REFRESH_EACH_REQUEST + update_session_activity ghi last_activity);
+chữ ký lớn còn làm cookie vượt 4 KB và bị trình duyệt bỏ.
+
+    - Cookie: session id ngẫu nhiên 256 bit (43 ký tự)
+    - Backend chọn theo SESSION_STORE_URL:
+        sqlite:///instance/sessions.db : dùng chung giữa các worker trên 1 máy (mặc định)
+        redis://host:6379/0            : dùng chung giữa các worker / máy (SETEX, Redis tự hết hạn)
+        cookie://                      : giữ session cookie của Flask như cũ
+    - Serialize giống session cookie (TaggedJSONSerializer: datetime, bytes, tuple...)
+    - Chỉ ghi lại khi session thay đổi; không đổi thì chỉ gia hạn TTL, tối đa 1 lần / SESSION_STORE_TOUCH_SECONDS
+    - session.clear() (đăng nhập / đăng xuất) -> cấp session id mới, xoá bản ghi cũ
+    - Hết hạn: PERMANENT_SESSION_LIFETIME; SQLite dọn bản ghi hết hạn định kỳ
+"""
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_URL = os.environ.get('SESSION_STORE_URL', 'sqlite:///instance/sessions.db')
+# Session không đổi: gia hạn TTL trong store tối đa 1 lần / chừng này giây
+SESSION_STORE_TOUCH_SECONDS = int(os.environ.get('SESSION_STORE_TOUCH_SECONDS', 60))
+
+_SID_BYTES = 32
+_SID_LENGTH = 43  # len(secrets.token_urlsafe(32))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Dict session + session id; modified bật khi có thay đổi, rotate bật khi clear()"""
+
+    def __init__(self, initial=None, sid: Optional[str] = None, new: bool = False, expires_at: float = 0.0):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.rotate = False
+
+    def clear(self):
+        super().clear()
+        self.rotate = True
+
+
+class SQLiteSessionBackend:
+    """Bảng flask_sessions trong file SQLite riêng (không dùng chung kết nối với DB chính)"""
+
+    SWEEP_INTERVAL = 300  # giây
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS flask_sessions ("
+            " sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_flask_sessions_expires ON flask_sessions (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid: str) -> Optional[Tuple[str, float]]:
+        row = self._connection().execute(
+            "SELECT data, expires_at FROM flask_sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, sid: str, data: str, ttl: int) -> float:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO flask_sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+                     (sid, data, now + ttl))
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.SWEEP_INTERVAL
+            conn.execute("DELETE FROM flask_sessions WHERE expires_at < ?", (now,))
+        return now + ttl
+
+    def touch(self, sid: str, ttl: int) -> float:
+        expires_at = time.time() + ttl
+        self._connection().execute("UPDATE flask_sessions SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+        return expires_at
+
+    def delete(self, sid: str) -> None:
+        self._connection().execute("DELETE FROM flask_sessions WHERE sid = ?", (sid,))
+
+    def count(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM flask_sessions WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+
+class RedisSessionBackend:
+    """Mỗi session 1 key session:<sid> với TTL (Redis tự xoá khi hết hạn)"""
+
+    def __init__(self, url: str):
+        import redis  # Chỉ cần khi cấu hình Redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self._client.ping()
+
+    @staticmethod
+    def _key(sid: str) -> str:
+        return f"session:{sid}"
+
+    def get(self, sid: str) -> Optional[Tuple[str, float]]:
+        pipe = self._client.pipeline()
+        pipe.get(self._key(sid))
+        pipe.pttl(self._key(sid))
+        data, pttl = pipe.execute()
+        if data is None:
+            return None
+        return data.decode('utf-8'), time.time() + max(pttl, 0) / 1000
+
+    def set(self, sid: str, data: str, ttl: int) -> float:
+        self._client.setex(self._key(sid), ttl, data)
+        return time.time() + ttl
+
+    def touch(self, sid: str, ttl: int) -> float:
+        self._client.expire(self._key(sid), ttl)
+        return time.time() + ttl
+
+    def delete(self, sid: str) -> None:
+        self._client.delete(self._key(sid))
+
+    def count(self) -> int:
+        return sum(1 for _ in self._client.scan_iter(match='session:*', count=500))
+
+
+def create_session_backend(url: Optional[str]):
+    """Tạo backend theo URL; cookie:// hoặc lỗi kết nối -> None (giữ session cookie của Flask)"""
+    url = (url or 'cookie://').strip()
+    try:
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            return RedisSessionBackend(url)
+        if url.startswith('sqlite:///'):
+            return SQLiteSessionBackend(url[len('sqlite:///'):])
+        if not url.startswith('cookie://'):
+            logger.warning(f"SESSION_STORE_URL không hỗ trợ: {url}, dùng session cookie")
+    except Exception as e:
+        logger.warning(f"Không mở được session store {url}: {e}. Dùng session cookie")
+    return None
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """SessionInterface của Flask: cookie = session id, dữ liệu trong backend"""
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSideSession
+
+    def __init__(self, backend, url: str, touch_seconds: int = SESSION_STORE_TOUCH_SECONDS):
+        self.backend = backend
+        self.url = url
+        self.touch_seconds = touch_seconds
+        self.reads = 0
+        self.writes = 0
+        self.touches = 0
+        self.errors = 0
+
+    @staticmethod
+    def _new_sid() -> str:
+        return secrets.token_urlsafe(_SID_BYTES)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) == _SID_LENGTH:
+            try:
+                stored = self.backend.get(sid)
+                self.reads += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Không đọc được session từ store: {e}")
+                stored = None
+            if stored is not None:
+                data, expires_at = stored
+                try:
+                    return self.session_class(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+                except Exception as e:
+                    logger.warning(f"Session {sid[:8]}... hỏng, tạo session mới: {e}")
+        return self.session_class(sid=self._new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        try:
+            if not session:
+                # Session rỗng: xoá bản ghi + cookie nếu trước đó đã có
+                if not session.new and (session.modified or session.rotate):
+                    self.backend.delete(session.sid)
+                    response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                           samesite=samesite, httponly=httponly)
+                return
+
+            ttl = int(app.permanent_session_lifetime.total_seconds())
+            if session.rotate and not session.new:
+                # Đăng nhập / đăng xuất: không giữ session id cũ (chống session fixation)
+                self.backend.delete(session.sid)
+                session.sid = self._new_sid()
+
+            if session.modified or session.rotate or session.new:
+                session.expires_at = self.backend.set(session.sid, self.serializer.dumps(dict(session)), ttl)
+                self.writes += 1
+            else:
+                # Không đổi: chỉ gia hạn TTL trong store (kể cả session không permanent)
+                if session.expires_at - time.time() < ttl - self.touch_seconds:
+                    session.expires_at = self.backend.touch(session.sid, ttl)
+                    self.touches += 1
+                if not self.should_set_cookie(app, session):
+                    return
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Không ghi được session vào store: {e}")
+            return
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=httponly, domain=domain, path=path, secure=secure, samesite=samesite)
+
+    def stats(self) -> dict:
+        try:
+            active = self.backend.count()
+        except Exception:
+            active = None
+        return {
+            'backend': type(self.backend).__name__,
+            'url': self.url,
+            'active_sessions': active,
+            'reads': self.reads,
+            'writes': self.writes,
+            'touches': self.touches,
+            'errors': self.errors,
+        }
+
+
+def init_session_store(app, url: Optional[str] = None) -> Optional[ServerSideSessionInterface]:
+    """Gắn session phía server vào app (url mặc định: SESSION_STORE_URL trong config / env)"""
+    url = url or app.config.get('SESSION_STORE_URL') or SESSION_STORE_URL
+    backend = create_session_backend(url)
+    if backend is None:
+        return None
+    app.session_interface = ServerSideSessionInterface(backend, url)
+    logger.info(f"Session phía server: {url}")
+    return app.session_interface
@@ -0,0 +1,134 @@
+"""
+Chỉ mục ngày -> dòng cho sheet timesheet của nhân viên
+
+Trước đây mỗi lần tìm dòng, _find_row_by_date sinh ~12 biến thể chuỗi ngày (strptime qua 5 format)
+rồi dò substring từng dòng với từng biến thể; việc này lặp lại cho mọi record của cùng 1 sheet.
+
+    - Đọc sheet 1 lần -> SheetIndex: mỗi ô cột ngày chuẩn hoá thành date, map date -> số dòng
+    - Tra cứu O(1); dùng lại cho mọi record của sheet trong cùng lô
+    - Ô ngày không parse được (tiêu đề, dòng tổng...) giữ lại để dò chuỗi kiểu cũ khi tra trượt
+    - Header map (tiêu đề chuẩn hoá -> index cột) tính 1 lần cùng chỉ mục
+"""
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# Cột A (ngày) .. P (ghi chú): mọi cột mà cập nhật timesheet đọc / ghi
+TIMESHEET_READ_RANGE = 'A1:P1000'
+
+# 2025/12/1, 2025-12-01, 2025.12.1, 2025年12月1日 (có thể kèm thứ phía sau)
+_YMD = re.compile(r'(\d{4})\s*[/\-.年]\s*(\d{1,2})\s*[/\-.月]\s*(\d{1,2})')
+# 1/12/2025, 01-12-2025 (ngày/tháng hoặc tháng/ngày)
+_DMY = re.compile(r'(\d{1,2})\s*[/\-.]\s*(\d{1,2})\s*[/\-.]\s*(\d{4})')
+
+_INPUT_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y')
+
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_cell_dates(value) -> List[date]:
+    """
+    Các ngày mà 1 ô có thể biểu diễn.
+    Dạng d/m/Y mơ hồ (1/12/2025) trả về cả 1/12 và 12/1 - giống cách dò biến thể cũ.
+    """
+    if value is None:
+        return []
+    if isinstance(value, datetime):
+        return [value.date()]
+    if isinstance(value, date):
+        return [value]
+    text = str(value).strip()
+    if not text:
+        return []
+
+    match = _YMD.search(text)
+    if match:
+        parsed = _safe_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+        return [parsed] if parsed else []
+
+    match = _DMY.search(text)
+    if match:
+        first, second, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
+        candidates = [_safe_date(year, second, first), _safe_date(year, first, second)]
+        return [d for i, d in enumerate(candidates) if d and d not in candidates[:i]]
+    return []
+
+
+def parse_lookup_date(value: Union[str, date, datetime, None]) -> Optional[date]:
+    """Ngày cần tìm (thường là 'YYYY-MM-DD' trong attendance_data)"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        pass
+    for fmt in _INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_header(cell) -> str:
+    try:
+        return str(cell).strip().lower() if cell is not None else ''
+    except Exception:
+        return ''
+
+
+class SheetIndex:
+    """Dữ liệu 1 sheet đã đọc + chỉ mục ngày -> dòng (1-based) và header map"""
+
+    def __init__(self, rows: Sequence[Sequence], date_col_index: int = 0):
+        self.rows = rows or []
+        self.date_col_index = date_col_index
+        self._row_by_date: Dict[date, int] = {}
+        # (số dòng, nội dung ô) của các ô cột ngày không parse được
+        self.unparsed: List[Tuple[int, str]] = []
+        self.header_map: Dict[str, int] = {}
+
+        if self.rows:
+            for idx, cell in enumerate(self.rows[0]):
+                normalized = normalize_header(cell)
+                if normalized:
+                    self.header_map[normalized] = idx
+
+        for i, row in enumerate(self.rows):
+            if len(row) <= date_col_index:
+                continue
+            cell = row[date_col_index]
+            dates = parse_cell_dates(cell)
+            if not dates:
+                text = str(cell).strip() if cell is not None else ''
+                if text:
+                    self.unparsed.append((i + 1, text))
+                continue
+            for parsed in dates:
+                # Trùng ngày: giữ dòng đầu tiên (giống dò tuần tự trước đây)
+                self._row_by_date.setdefault(parsed, i + 1)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row_for(self, value) -> Optional[int]:
+        parsed = parse_lookup_date(value)
+        if parsed is None:
+            return None
+        return self._row_by_date.get(parsed)
+
+    def row_values(self, row_number: int) -> Sequence:
+        """Giá trị hiện tại của 1 dòng (1-based), [] nếu ngoài vùng đã đọc"""
+        if row_number and 0 < row_number <= len(self.rows):
+            return self.rows[row_number - 1]
+        return []
@@ -0,0 +1,512 @@
+"""
+Outbox bền vững cho cập nhật Google Sheet (bảng sheet_sync_outbox)
+
+Trước đây update_google_sheet_background_safe đẩy vào Queue trong bộ nhớ, 1 daemon thread
+xử lý: restart / crash là mất việc đang chờ, gặp 429 thì rơi về gọi từng bản ghi + sleep(1.2).
+
+    - enqueue ghi 1 dòng vào DB (commit ngay) -> restart xong worker làm tiếp từ DB
+    - Cùng task_key (cùng ngày chấm công / ngày nghỉ -> cùng ô trên sheet) còn đang chờ
+      thì chỉ cập nhật payload: ghi giá trị mới nhất, không ghi nhiều lần
+    - Mỗi spreadsheet (team + tháng) có token bucket riêng; lỗi -> backoff luỹ thừa + jitter
+      qua next_retry_at, quá SHEET_SYNC_MAX_ATTEMPTS lần -> 'failed' (admin thử lại được)
+    - Dòng 'processing' quá SHEET_SYNC_LEASE_SECONDS (worker chết giữa chừng) -> trả về 'pending'
+    - Dòng đã có dòng mới hơn cùng task_key (được thêm khi dòng cũ đang 'processing') thì không gửi /
+      thử lại nữa mà đóng luôn ('done') - gửi lại sẽ ghi payload cũ đè giá trị mới trên sheet
+    - Sau mỗi lô, LeaveRequest.google_sheet_* được tính lại từ trạng thái outbox của đơn
+"""
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models import db, LeaveRequest, SheetSyncTask
+from utils.google_quota import GOOGLE_SHEETS_SYNC_WORKERS
+
+logger = logging.getLogger(__name__)
+
+SHEET_SYNC_BATCH_SIZE = int(os.environ.get('SHEET_SYNC_BATCH_SIZE', 50))
+SHEET_SYNC_POLL_INTERVAL = float(os.environ.get('SHEET_SYNC_POLL_INTERVAL', 2.0))
+# Token bucket cho mỗi spreadsheet: số lô / giây và số lô được dồn
+SHEET_SYNC_SPREADSHEET_RATE = float(os.environ.get('SHEET_SYNC_SPREADSHEET_RATE', 0.5))
+SHEET_SYNC_SPREADSHEET_BURST = int(os.environ.get('SHEET_SYNC_SPREADSHEET_BURST', 2))
+SHEET_SYNC_MAX_ATTEMPTS = int(os.environ.get('SHEET_SYNC_MAX_ATTEMPTS', 8))
+SHEET_SYNC_BACKOFF_BASE = float(os.environ.get('SHEET_SYNC_BACKOFF_BASE', 5))
+SHEET_SYNC_BACKOFF_MAX = float(os.environ.get('SHEET_SYNC_BACKOFF_MAX', 900))
+SHEET_SYNC_LEASE_SECONDS = int(os.environ.get('SHEET_SYNC_LEASE_SECONDS', 600))
+SHEET_SYNC_DONE_RETENTION_DAYS = int(os.environ.get('SHEET_SYNC_DONE_RETENTION_DAYS', 7))
+
+STATE_PENDING = 'pending'
+STATE_PROCESSING = 'processing'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+# Task key của đơn nghỉ: leave-<id>-<ngày thứ>, break30-<id>, late_early-<id>
+_LEAVE_TASK_KEY = re.compile(r'^(?:leave|break30|late_early)-(\d+)(?:-|$)')
+
+
+def leave_request_id_from_key(task_key: str) -> Optional[int]:
+    match = _LEAVE_TASK_KEY.match(task_key or '')
+    return int(match.group(1)) if match else None
+
+
+def spreadsheet_key_for(employee_team: Optional[str], date_str: Optional[str]) -> str:
+    """(team, tháng) -> 1 file timesheet, cùng cách gom của batch_update_multi_attendances_sync"""
+    month = ''
+    if date_str:
+        try:
+            month = datetime.strptime(date_str, '%Y-%m-%d').strftime('%Y%m')
+        except ValueError:
+            pass
+    return f"{employee_team or ''}|{month}"
+
+
+def is_rate_limit_error(error: Optional[str]) -> bool:
+    text = (error or '').lower()
+    return '429' in text or 'rate_limit' in text or 'ratelimit' in text or 'quota' in text
+
+
+def backoff_seconds(attempts: int, rate_limited: bool = False) -> float:
+    """Backoff luỹ thừa theo số lần thử (429 chờ gấp đôi), jitter 50-100% để các dòng không dồn cùng lúc"""
+    delay = SHEET_SYNC_BACKOFF_BASE * (2 ** max(0, attempts - 1))
+    if rate_limited:
+        delay *= 2
+    delay = min(delay, SHEET_SYNC_BACKOFF_MAX)
+    return delay * (0.5 + random.random() / 2)
+
+
+class TokenBucket:
+    """Token bucket đơn giản (không thread-safe, chỉ vòng lặp chính của worker dùng)"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def penalize(self, seconds: float) -> None:
+        """Bị 429: rút cạn bucket, ~seconds giây nữa mới có token lại"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class _TaskRef:
+    """batch_update_multi_attendances_sync chỉ cần .id -> dùng id của dòng outbox"""
+    __slots__ = ('id',)
+
+    def __init__(self, task_id: int):
+        self.id = task_id
+
+
+class SheetSyncOutbox:
+    """Ghi việc vào outbox + worker thread xử lý theo lịch (token bucket, backoff)"""
+
+    def __init__(self):
+        self._app = None
+        self._engine = None
+        self._processor: Optional[Callable] = None
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'coalesced': 0, 'batches': 0, 'done': 0, 'retried': 0,
+                       'failed': 0, 'rate_limited': 0, 'throttled': 0, 'recovered': 0, 'superseded': 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        # Tăng từ thread request (enqueue) lẫn thread của pool xử lý -> cần khoá
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def init_app(self, app, processor: Callable) -> None:
+        """processor(list[(task, team, employee_id, data)]) -> {'success_ids', 'failed'} (batch_update_multi_attendances_sync)"""
+        self._app = app
+        self._processor = processor
+        with app.app_context():
+            self._engine = db.engine
+
+    def _session(self) -> Session:
+        # Session riêng: không commit hộ transaction đang dở của request gọi enqueue
+        return Session(bind=self._engine, autoflush=False, expire_on_commit=False)
+
+    # ------------------------------------------------------------------
+    # Ghi việc
+    # ------------------------------------------------------------------
+
+    def enqueue(self, task_key: str, employee_team: Optional[str], employee_id, attendance_data: dict) -> int:
+        """Thêm / gộp 1 lần ghi sheet; trả về id dòng outbox"""
+        payload = json.loads(json.dumps(attendance_data, default=str))
+        date_str = payload.get('date')
+        leave_request_id = leave_request_id_from_key(str(task_key))
+        now = datetime.utcnow()
+        values = dict(
+            employee_team=employee_team,
+            employee_id=str(employee_id) if employee_id is not None else None,
+            sheet_date=date_str,
+            spreadsheet_key=spreadsheet_key_for(employee_team, date_str),
+            payload=payload,
+            state=STATE_PENDING,
+            attempts=0,
+            next_retry_at=now,
+            last_error=None,
+        )
+        with self._session() as session:
+            # Gộp bằng UPDATE có điều kiện state: worker có thể vừa _claim dòng này (-> 'processing')
+            # sau lúc SELECT; khi đó UPDATE không khớp dòng nào và ta thêm dòng mới phía sau,
+            # không ghi đè dòng đang xử lý (giá trị mới sẽ bị mất khi worker đánh dấu 'done')
+            candidate_id = (session.query(SheetSyncTask.id)
+                            .filter(SheetSyncTask.task_key == str(task_key),
+                                    SheetSyncTask.state.in_((STATE_PENDING, STATE_FAILED)))
+                            .order_by(SheetSyncTask.id.desc())
+                            .limit(1)
+                            .scalar())
+            coalesced = 0
+            if candidate_id is not None:
+                coalesced = (session.query(SheetSyncTask)
+                             .filter(SheetSyncTask.id == candidate_id,
+                                     SheetSyncTask.state.in_((STATE_PENDING, STATE_FAILED)))
+                             .update(dict(values, updated_at=now), synchronize_session=False))
+            if coalesced:
+                task_id = candidate_id
+                self._count('coalesced')
+            else:
+                task = SheetSyncTask(task_key=str(task_key), leave_request_id=leave_request_id, **values)
+                session.add(task)
+                session.flush()
+                task_id = task.id
+                self._count('enqueued')
+            if leave_request_id:
+                self._refresh_leaves(session, [leave_request_id])
+            session.commit()
+
+        self.start()
+        self._wake.set()
+        return task_id
+
+    def retry_failed(self, leave_request_id: Optional[int] = None) -> int:
+        """Đưa các dòng 'failed' về 'pending' (tất cả hoặc của 1 đơn nghỉ); dòng đã có bản mới hơn thì đóng"""
+        with self._session() as session:
+            query = session.query(SheetSyncTask).filter(SheetSyncTask.state == STATE_FAILED)
+            if leave_request_id is not None:
+                query = query.filter(SheetSyncTask.leave_request_id == leave_request_id)
+            tasks = query.all()
+            superseded = self._superseded_ids(session, tasks)
+            now = datetime.utcnow()
+            count = 0
+            for task in tasks:
+                if task.id in superseded:
+                    self._retire(task, now)
+                    continue
+                task.state = STATE_PENDING
+                task.attempts = 0
+                task.next_retry_at = now
+                count += 1
+            if superseded:
+                self._refresh_leaves(session, {t.leave_request_id for t in tasks
+                                               if t.id in superseded and t.leave_request_id})
+            session.commit()
+        if count:
+            self.start()
+            self._wake.set()
+        return count
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._engine is None:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='sheet-sync-outbox', daemon=True)
+            self._thread.start()
+        logger.info("Đã khởi động worker outbox Google Sheet")
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(SHEET_SYNC_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                if self.run_once():
+                    # Còn việc đến hạn -> làm tiếp ngay
+                    self._wake.set()
+            except Exception as e:
+                logger.error(f"Lỗi worker outbox Google Sheet: {e}", exc_info=True)
+                time.sleep(1)
+
+    def _bucket(self, spreadsheet_key: str) -> TokenBucket:
+        bucket = self._buckets.get(spreadsheet_key)
+        if bucket is None:
+            bucket = self._buckets[spreadsheet_key] = TokenBucket(
+                SHEET_SYNC_SPREADSHEET_RATE, SHEET_SYNC_SPREADSHEET_BURST)
+        return bucket
+
+    def run_once(self) -> bool:
+        """1 vòng: thu hồi lease hết hạn, lấy việc đến hạn, chạy 1 lô cho mỗi spreadsheet còn token"""
+        now = datetime.utcnow()
+        with self._session() as session:
+            recovered = (session.query(SheetSyncTask)
+                         .filter(SheetSyncTask.state == STATE_PROCESSING,
+                                 SheetSyncTask.updated_at < now - timedelta(seconds=SHEET_SYNC_LEASE_SECONDS))
+                         .update({'state': STATE_PENDING, 'updated_at': now}, synchronize_session=False))
+            self._count('recovered', recovered or 0)
+            self._purge_done(session)
+            session.commit()
+
+            due = (session.query(SheetSyncTask.id, SheetSyncTask.spreadsheet_key)
+                   .filter(SheetSyncTask.state == STATE_PENDING, SheetSyncTask.next_retry_at <= now)
+                   .order_by(SheetSyncTask.next_retry_at, SheetSyncTask.id)
+                   .limit(SHEET_SYNC_BATCH_SIZE * 4)
+                   .all())
+
+        groups: Dict[str, List[int]] = {}
+        for task_id, spreadsheet_key in due:
+            groups.setdefault(spreadsheet_key or '', []).append(task_id)
+
+        ready = []
+        for spreadsheet_key, ids in groups.items():
+            if not self._bucket(spreadsheet_key).try_acquire():
+                self._count('throttled')
+                continue
+            ready.append((spreadsheet_key, ids[:SHEET_SYNC_BATCH_SIZE]))
+        if not ready:
+            return False
+
+        # Các spreadsheet khác nhau chạy song song; quota API chung do utils/google_quota.py giữ
+        workers = max(1, min(GOOGLE_SHEETS_SYNC_WORKERS, len(ready)))
+        if workers == 1:
+            outcomes = [self._process(key, ids) for key, ids in ready]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheet-sync-outbox') as executor:
+                outcomes = list(executor.map(lambda item: self._process(*item), ready))
+
+        progressed = False
+        for (spreadsheet_key, _), (processed, rate_limited_delay) in zip(ready, outcomes):
+            progressed = progressed or processed
+            if rate_limited_delay:
+                self._bucket(spreadsheet_key).penalize(rate_limited_delay)
+        return progressed
+
+    def _claim(self, session: Session, ids: Iterable[int]) -> List[SheetSyncTask]:
+        """Chuyển pending -> processing từng dòng; dòng đã bị worker khác lấy thì bỏ qua"""
+        now = datetime.utcnow()
+        claimed = []
+        for task_id in ids:
+            updated = (session.query(SheetSyncTask)
+                       .filter(SheetSyncTask.id == task_id, SheetSyncTask.state == STATE_PENDING)
+                       .update({'state': STATE_PROCESSING, 'updated_at': now}, synchronize_session=False))
+            if updated:
+                claimed.append(task_id)
+        session.commit()
+        if not claimed:
+            return []
+        return session.query(SheetSyncTask).filter(SheetSyncTask.id.in_(claimed)).all()
+
+    def _superseded_ids(self, session: Session, tasks: Iterable[SheetSyncTask]) -> set:
+        """id các dòng đã có dòng mới hơn (id lớn hơn) cùng task_key"""
+        tasks = list(tasks)
+        keys = {t.task_key for t in tasks}
+        if not keys:
+            return set()
+        newest = dict(session.query(SheetSyncTask.task_key, func.max(SheetSyncTask.id))
+                      .filter(SheetSyncTask.task_key.in_(keys))
+                      .group_by(SheetSyncTask.task_key)
+                      .all())
+        return {t.id for t in tasks if newest.get(t.task_key, t.id) > t.id}
+
+    def _retire(self, task: SheetSyncTask, now: datetime) -> None:
+        """Đóng dòng cũ: dòng mới hơn cùng task_key sẽ ghi giá trị mới nhất lên ô này"""
+        task.state = STATE_DONE
+        task.done_at = now
+        task.updated_at = now
+        task.last_error = None
+        self._count('superseded')
+
+    def _process(self, spreadsheet_key: str, ids: List[int]):
+        """Chạy 1 lô của 1 spreadsheet; trả về (đã xử lý?, số giây phạt bucket nếu bị 429)"""
+        with self._session() as session:
+            tasks = self._claim(session, ids)
+            if not tasks:
+                return False, 0.0
+
+            # Dòng cũ được trả về 'pending' (thu hồi lease) trong khi đã có dòng mới hơn -> không gửi
+            superseded = self._superseded_ids(session, tasks)
+            if superseded:
+                now = datetime.utcnow()
+                for task in tasks:
+                    if task.id in superseded:
+                        self._retire(task, now)
+                self._refresh_leaves(session, {t.leave_request_id for t in tasks
+                                               if t.id in superseded and t.leave_request_id})
+                session.commit()
+                tasks = [t for t in tasks if t.id not in superseded]
+                if not tasks:
+                    return True, 0.0
+
+            batch = [(_TaskRef(t.id), t.employee_team, t.employee_id, t.payload) for t in tasks]
+            self._count('batches')
+            try:
+                with self._app.app_context():
+                    result = self._processor(batch)
+                success_ids = set(result.get('success_ids') or [])
+                errors = {item['id']: item.get('error') for item in result.get('failed') or []}
+            except Exception as e:
+                success_ids, errors = set(), {t.id: str(e) for t in tasks}
+
+            # Có thể đã có dòng mới hơn được thêm trong lúc gửi lô này -> dòng lỗi không thử lại nữa
+            superseded = self._superseded_ids(session, [t for t in tasks if t.id not in success_ids])
+            now = datetime.utcnow()
+            rate_limited_delay = 0.0
+            for task in tasks:
+                task.attempts = (task.attempts or 0) + 1
+                task.updated_at = now
+                if task.id in success_ids:
+                    task.state = STATE_DONE
+                    task.done_at = now
+                    task.last_error = None
+                    self._count('done')
+                    continue
+                if task.id in superseded:
+                    self._retire(task, now)
+                    continue
+
+                error = errors.get(task.id) or 'Không có kết quả cập nhật'
+                task.last_error = error[:2000]
+                rate_limited = is_rate_limit_error(error)
+                if rate_limited:
+                    self._count('rate_limited')
+                if task.attempts >= SHEET_SYNC_MAX_ATTEMPTS:
+                    task.state = STATE_FAILED
+                    self._count('failed')
+                else:
+                    delay = backoff_seconds(task.attempts, rate_limited)
+                    if rate_limited:
+                        rate_limited_delay = max(rate_limited_delay, delay)
+                    task.state = STATE_PENDING
+                    task.next_retry_at = now + timedelta(seconds=delay)
+                    self._count('retried')
+
+            self._refresh_leaves(session, {t.leave_request_id for t in tasks if t.leave_request_id})
+            session.commit()
+
+        logger.info(f"Outbox Google Sheet [{spreadsheet_key}]: {len(success_ids)}/{len(tasks)} dòng thành công")
+        return True, rate_limited_delay
+
+    def _purge_done(self, session: Session) -> None:
+        """Xoá dòng 'done' cũ (tối đa 1 lần / giờ)"""
+        if time.monotonic() - self._last_purge < 3600:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(days=SHEET_SYNC_DONE_RETENTION_DAYS)
+        session.query(SheetSyncTask).filter(
+            SheetSyncTask.state == STATE_DONE, SheetSyncTask.done_at < cutoff
+        ).delete(synchronize_session=False)
+
+    # ------------------------------------------------------------------
+    # Trạng thái theo đơn nghỉ
+    # ------------------------------------------------------------------
+
+    def _refresh_leaves(self, session: Session, leave_request_ids: Iterable[int]) -> None:
+        """google_sheet_synced = mọi dòng outbox của đơn đã 'done'; còn lỗi -> google_sheet_sync_error"""
+        summaries = self._leave_summaries(session, leave_request_ids)
+        for leave_request_id, summary in summaries.items():
+            leave_request = session.get(LeaveRequest, leave_request_id)
+            if leave_request is None:
+                continue
+            synced = summary['total'] > 0 and summary['done'] == summary['total']
+            leave_request.google_sheet_synced = synced
+            leave_request.google_sheet_sync_error = None if synced else summary['last_error']
+            if synced:
+                leave_request.google_sheet_sync_at = summary['done_at']
+
+    def _leave_summaries(self, session: Session, leave_request_ids: Iterable[int]) -> Dict[int, dict]:
+        ids = [i for i in set(leave_request_ids) if i]
+        if not ids:
+            return {}
+        summaries = {i: {'total': 0, STATE_PENDING: 0, STATE_PROCESSING: 0, STATE_DONE: 0, STATE_FAILED: 0,
+                         'attempts': 0, 'next_retry_at': None, 'last_error': None, 'done_at': None}
+                     for i in ids}
+        rows = (session.query(SheetSyncTask.leave_request_id, SheetSyncTask.state,
+                              func.count(SheetSyncTask.id), func.max(SheetSyncTask.attempts),
+                              func.min(SheetSyncTask.next_retry_at), func.max(SheetSyncTask.done_at))
+                .filter(SheetSyncTask.leave_request_id.in_(ids))
+                .group_by(SheetSyncTask.leave_request_id, SheetSyncTask.state)
+                .all())
+        for leave_request_id, state, count, attempts, next_retry_at, done_at in rows:
+            summary = summaries[leave_request_id]
+            summary['total'] += count
+            summary[state] = summary.get(state, 0) + count
+            summary['attempts'] = max(summary['attempts'], attempts or 0)
+            if state == STATE_PENDING:
+                summary['next_retry_at'] = next_retry_at
+            if state == STATE_DONE:
+                summary['done_at'] = done_at
+        errors = (session.query(SheetSyncTask.leave_request_id, SheetSyncTask.last_error)
+                  .filter(SheetSyncTask.leave_request_id.in_(ids),
+                          SheetSyncTask.state != STATE_DONE,
+                          SheetSyncTask.last_error.isnot(None))
+                  .order_by(SheetSyncTask.updated_at)
+                  .all())
+        for leave_request_id, last_error in errors:
+            summaries[leave_request_id]['last_error'] = last_error
+        return summaries
+
+    def leave_status(self, leave_request_ids: Iterable[int]) -> Dict[int, dict]:
+        """Trạng thái outbox theo đơn nghỉ cho /api/admin/pending-sync (đơn chưa có dòng nào: không có trong kết quả)"""
+        if self._engine is None:
+            return {}
+        with self._session() as session:
+            summaries = self._leave_summaries(session, leave_request_ids)
+        return {i: s for i, s in summaries.items() if s['total']}
+
+    def has_tasks(self, leave_request_id: int) -> bool:
+        return bool(self.leave_status([leave_request_id]))
+
+    def stats(self) -> dict:
+        counts = {STATE_PENDING: 0, STATE_PROCESSING: 0, STATE_DONE: 0, STATE_FAILED: 0}
+        oldest_pending = None
+        if self._engine is not None:
+            with self._session() as session:
+                for state, count in session.query(SheetSyncTask.state, func.count(SheetSyncTask.id)) \
+                        .group_by(SheetSyncTask.state).all():
+                    counts[state] = count
+                oldest_pending = session.query(func.min(SheetSyncTask.created_at)) \
+                    .filter(SheetSyncTask.state == STATE_PENDING).scalar()
+        with self._stats_lock:
+            counters = dict(self._stats)
+        return dict(
+            counters,
+            states=counts,
+            oldest_pending_at=oldest_pending.isoformat(timespec='seconds') if oldest_pending else None,
+            spreadsheets=len(self._buckets),
+            running=bool(self._thread and self._thread.is_alive()),
+            spreadsheet_rate=SHEET_SYNC_SPREADSHEET_RATE,
+            max_attempts=SHEET_SYNC_MAX_ATTEMPTS,
+        )
+
+
+# Global instance dùng cho app.py (update_google_sheet_background_safe)
+sheet_sync_outbox = SheetSyncOutbox()
@@ -0,0 +1,665 @@
+"""
+Bộ tính giờ công / tăng ca theo ca làm việc (dùng chung cho model Attendance, validate form và export)
+
+Trước đây Attendance.update_work_hours (~480 dòng) dựng lại shift_map, cấu hình FileHandler
+logger "attendance_logic" và ghi nhiều dòng debug ở MỖI lần gọi; to_dict() lại gọi
+calculate_regular_work_hours cho từng dòng được serialize.
+
+    - Bảng ca chuẩn SHIFT_TABLE tính sẵn 1 lần (giờ vào/ra dạng time + phút trong ngày)
+    - Hàm thuần, không side effect, không log: đầu vào ShiftInput -> ShiftResult
+    - Mốc thời gian là số nguyên micro giây tính từ 0h ngày chấm công: so sánh / cắt cửa sổ
+      bằng số nguyên, phút làm tròn giống hệt timedelta.total_seconds() / 60 của code cũ
+      -> kết quả trùng từng bit với cách tính cũ (kiểm bằng scripts/check_shift_engine_golden.py)
+    - compute_minutes_batch: tính phút công / giờ công / OT trước-sau 22h cho nhiều bản ghi
+      cùng lúc trên mảng phút (NumPy nếu có, không có thì vòng lặp Python cùng công thức)
+"""
+from datetime import datetime, time, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from utils.lazy_imports import lazy, module_available
+
+# NumPy chỉ được nạp ở lần gọi compute_minutes_batch đầu tiên; thiếu thì dùng vòng lặp Python
+np = lazy('numpy') if module_available('numpy') else None
+
+_US_PER_MINUTE = 60 * 1_000_000
+_US_PER_DAY = 24 * 60 * _US_PER_MINUTE
+
+DAY_NORMAL = 0
+DAY_WEEKEND = 1
+DAY_VIETNAMESE_HOLIDAY = 2
+DAY_JAPANESE_HOLIDAY = 3
+
+DAY_TYPE_CODES = {
+    'weekend': DAY_WEEKEND,
+    'vietnamese_holiday': DAY_VIETNAMESE_HOLIDAY,
+    'japanese_holiday': DAY_JAPANESE_HOLIDAY,
+}
+
+# Ngày nghỉ: không trừ đối ứng trong ca, mọi giờ làm là tăng ca
+DAY_OFF_TYPES = ('weekend', 'vietnamese_holiday')
+
+# Ca áp dụng chính sách mẹ <12 tháng
+MATERNITY_SHIFT_CODES = ('1', '2', '3', '4')
+
+TWENTY_TWO_MINUTES = 22 * 60
+REGULAR_CAP_MINUTES = 8 * 60
+
+
+class ShiftDefinition(NamedTuple):
+    start: time
+    end: time
+    start_minutes: int
+    end_minutes: int  # ca qua đêm: đã cộng 1 ngày
+
+
+def _shift(start: time, end: time) -> ShiftDefinition:
+    start_minutes = start.hour * 60 + start.minute
+    end_minutes = end.hour * 60 + end.minute
+    if end <= start:
+        end_minutes += 24 * 60
+    return ShiftDefinition(start, end, start_minutes, end_minutes)
+
+
+# 5 ca chuẩn (bao gồm ca đặc biệt cho ngày nghỉ)
+SHIFT_TABLE: Dict[str, ShiftDefinition] = {
+    '1': _shift(time(7, 30), time(16, 30)),
+    '2': _shift(time(9, 0), time(18, 0)),
+    '3': _shift(time(11, 0), time(20, 0)),
+    '4': _shift(time(8, 0), time(17, 0)),
+    '5': _shift(time(0, 0), time(23, 59)),  # Ca đặc biệt: tự do giờ giấc cho ngày nghỉ
+}
+
+
+class ShiftInput(NamedTuple):
+    """Các cột của Attendance mà phép tính đọc (tên trùng tên cột)"""
+    date: object
+    check_in: Optional[datetime]
+    check_out: Optional[datetime]
+    shift_code: Optional[str] = None
+    shift_start: Optional[time] = None
+    shift_end: Optional[time] = None
+    holiday_type: Optional[str] = None
+    break_time: float = 1.0
+    break_time_minutes: Optional[int] = 60
+    comp_time_regular_minutes: Optional[int] = 0
+    comp_time_overtime_minutes: Optional[int] = 0
+    comp_time_ot_before_22_minutes: Optional[int] = 0
+    comp_time_ot_after_22_minutes: Optional[int] = 0
+    total_work_minutes: Optional[int] = None
+    regular_work_minutes: Optional[int] = None
+    total_work_hours: Optional[float] = None
+    regular_work_hours: Optional[float] = None
+    required_hours: Optional[float] = 8.0
+    overtime_before_22: Optional[str] = None
+    overtime_after_22: Optional[str] = None
+    is_maternity_flex: bool = False
+
+    @classmethod
+    def from_record(cls, record, is_maternity_flex: bool = False) -> 'ShiftInput':
+        """Đọc các cột cần thiết từ 1 bản ghi Attendance (hoặc object bất kỳ cùng thuộc tính)"""
+        defaults = cls._field_defaults
+        values = [getattr(record, name, defaults.get(name)) for name in cls._fields[:-1]]
+        inp = cls(*values, bool(is_maternity_flex))
+        # Bản ghi chưa flush có break_time = None (default của cột chỉ áp dụng khi INSERT) -> 1.0 như model
+        if inp.break_time is None:
+            inp = inp._replace(break_time=defaults['break_time'])
+        return inp
+
+
+class ShiftResult(NamedTuple):
+    """Giá trị update_work_hours ghi lại vào bản ghi (cột không đổi giữ giá trị cũ)"""
+    total_work_hours: Optional[float]
+    regular_work_hours: Optional[float]
+    overtime_before_22: Optional[str]
+    overtime_after_22: Optional[str]
+    shift_start: Optional[time]
+    shift_end: Optional[time]
+
+
+def minutes_to_hhmm(minutes) -> str:
+    """Phút nguyên -> 'H:MM'"""
+    if minutes is None or minutes < 0:
+        return "0:00"
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+def _minutes_to_hhmm_precise(minutes) -> str:
+    from utils.precision_utils import safe_minutes_to_hours, format_hours_minutes_precise
+
+    if minutes < 0:
+        minutes = 0
+    return format_hours_minutes_precise(safe_minutes_to_hours(minutes))
+
+
+def _us(delta: timedelta) -> int:
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _minutes(us: int) -> int:
+    # Cùng phép chia int/int như timedelta.total_seconds() rồi / 60
+    return int(round(us / 1_000_000 / 60))
+
+
+def _hours(us: int) -> float:
+    return us / 1_000_000 / 3600
+
+
+def _shift_window(day_start: datetime, shift_start: time, shift_end: time):
+    ca_start = _us(datetime.combine(day_start.date(), shift_start) - day_start)
+    ca_end = _us(datetime.combine(day_start.date(), shift_end) - day_start)
+    if not shift_end > shift_start:
+        ca_end += _US_PER_DAY
+    return ca_start, ca_end
+
+
+def _is_maternity_flex(inp: ShiftInput) -> bool:
+    return bool(inp.is_maternity_flex) and inp.shift_code in MATERNITY_SHIFT_CODES
+
+
+def compute_work_hours(inp: ShiftInput) -> ShiftResult:
+    """Tổng giờ làm, giờ công thường và tăng ca trước/sau 22h (thay cho Attendance.update_work_hours)"""
+    shift_start, shift_end = inp.shift_start, inp.shift_end
+    if not inp.check_in or not inp.check_out:
+        return ShiftResult(None, None, "0:00", "0:00", shift_start, shift_end)
+
+    # Chỉ gán giờ vào/ra ca chuẩn khi chưa có giá trị
+    definition = SHIFT_TABLE.get(inp.shift_code)
+    if definition is not None:
+        if not shift_start:
+            shift_start = definition.start
+        if not shift_end:
+            shift_end = definition.end
+
+    holiday_type = inp.holiday_type
+    day_start = datetime.combine(inp.date, time())
+    ci = _us(inp.check_in - day_start)
+    co = _us(inp.check_out - day_start)
+
+    # 1. Tổng giờ làm = thời gian thực tế - giờ nghỉ - đối ứng
+    duration_minutes = _minutes(co - ci)
+    break_minutes = int(round((inp.break_time or 0.0) * 60))
+    total_work_hours = round(max(0, duration_minutes - break_minutes) / 60.0, 2)
+
+    comp_regular = inp.comp_time_regular_minutes or 0
+    comp_overtime = inp.comp_time_overtime_minutes or 0
+    comp_before_22 = inp.comp_time_ot_before_22_minutes or 0
+    comp_after_22 = inp.comp_time_ot_after_22_minutes or 0
+
+    # Cuối tuần / lễ Việt Nam: chỉ trừ đối ứng tăng ca trước/sau 22h
+    total_comp_minutes = comp_before_22 + comp_after_22
+    if holiday_type not in DAY_OFF_TYPES:
+        total_comp_minutes += comp_regular + comp_overtime
+    if total_comp_minutes > 0:
+        total_work_hours = round(max(0, int(round(total_work_hours * 60)) - total_comp_minutes) / 60.0, 2)
+
+    regular_work_hours = inp.regular_work_hours
+    overtime_before_22 = inp.overtime_before_22
+    overtime_after_22 = inp.overtime_after_22
+
+    if shift_start and shift_end:
+        ca_start, ca_end = _shift_window(day_start, shift_start, shift_end)
+        twenty_two = TWENTY_TWO_MINUTES * _US_PER_MINUTE
+        maternity = _is_maternity_flex(inp)
+
+        # 2. Thời gian nằm trong ca (giờ, làm tròn 2 số lẻ như trước)
+        if inp.check_out.date() > inp.check_in.date():
+            time_in_shift = round(_hours(co - ci), 2)
+        else:
+            overlap_start = max(ci, ca_start)
+            overlap_end = min(co, ca_end)
+            if overlap_end <= overlap_start and inp.check_out.time() < inp.check_in.time():
+                time_in_shift = round(max(0, _hours(ca_end - ci)), 2)
+            else:
+                time_in_shift = round(max(0, _hours(overlap_end - overlap_start)), 2) if overlap_end > overlap_start else 0
+
+        maternity_bonus = 0.0
+        if holiday_type == 'vietnamese_holiday':
+            regular_work_hours = 8.0
+        elif holiday_type == 'weekend':
+            regular_work_hours = 0.0
+        elif holiday_type == 'japanese_holiday':
+            regular_base = min(total_work_hours or 0.0, 8.0)
+            regular_work_hours = round(max(0.0, regular_base - (comp_regular + comp_overtime) / 60.0), 2)
+        else:
+            effective_break = inp.break_time + comp_regular / 60.0
+            actual_hours = round(max(0, time_in_shift - effective_break), 2)
+            if maternity:
+                # Mẹ <12 tháng: luôn +1h, phần vượt 8h chuyển sang tăng ca
+                boosted_hours = actual_hours + 1.0
+                if boosted_hours <= 8.0:
+                    regular_work_hours = boosted_hours
+                else:
+                    regular_work_hours = 8.0
+                    maternity_bonus = boosted_hours - 8.0
+            elif inp.shift_code == '5':
+                regular_work_hours = 0.0  # Ca 5: không có giờ công, tất cả là OT
+            else:
+                regular_work_hours = min(actual_hours, 8.0)
+
+        # 3. Tăng ca thô trước / sau 22h (phút nguyên)
+        ot_before = 0
+        ot_after = 0
+        if holiday_type == 'vietnamese_holiday':
+            if co <= twenty_two:
+                ot_before = _minutes(co - ci)
+            elif ci < twenty_two:
+                ot_before = _minutes(twenty_two - ci)
+            ot2_start = max(ci, twenty_two)
+            ot_after = _minutes(co - ot2_start) if co > ot2_start else 0
+        elif holiday_type == 'weekend':
+            if ci < twenty_two:
+                ot_before = _minutes(min(co, twenty_two) - ci)
+                ot_before = max(0, ot_before - (inp.break_time_minutes or 60))
+            ot_after = _minutes(co - twenty_two) if co > twenty_two else 0
+        elif holiday_type == 'japanese_holiday':
+            # Phân bổ phần sau 22h trước, còn lại cho trước 22h (theo cột phút đã lưu)
+            regular_minutes = inp.regular_work_minutes or 0
+            overtime_total = max(0, (inp.total_work_minutes or 0) - regular_minutes)
+            if overtime_total > 0:
+                regular_end = ci + _us(timedelta(minutes=regular_minutes))
+                before_window_end = min(co, twenty_two)
+                capacity_before = _minutes(before_window_end - regular_end) if before_window_end > regular_end else 0
+                after_window_start = max(regular_end, twenty_two)
+                capacity_after = _minutes(co - after_window_start) if co > after_window_start else 0
+                ot_after = min(overtime_total, capacity_after)
+                ot_before = min(capacity_before, max(0, overtime_total - ot_after))
+        elif maternity:
+            post_shift = 0
+            if co > ca_end:
+                ot_end_22 = min(co, twenty_two)
+                if ot_end_22 > ca_end:
+                    post_shift = _minutes(ot_end_22 - ca_end)
+            ot_before = post_shift + int(round(maternity_bonus * 60))
+            ot_after = _minutes(co - twenty_two) if co > twenty_two else 0
+        else:
+            if inp.shift_code == '5':
+                # Phần trừ giờ nghỉ tràn sang sau 22h bị tính lại ngay bên dưới (giữ như cách tính cũ)
+                before_end = min(co, twenty_two)
+                raw_before = _minutes(before_end - ci) if before_end > ci else 0
+                break_mins = inp.break_time_minutes if inp.break_time_minutes else int(round((inp.break_time or 0.0) * 60))
+                ot_before = raw_before - min(raw_before, max(0, int(break_mins or 0)))
+            else:
+                # Ca 1-4: đi làm sớm + về muộn, cả hai chặn ở 22h
+                pre_end = min(co, ca_start, twenty_two)
+                pre_shift = max(0, _minutes(pre_end - ci)) if pre_end > ci and ci < ca_start else 0
+                post_start = max(ci, ca_end)
+                post_end = min(co, twenty_two)
+                post_shift = max(0, _minutes(post_end - post_start)) if post_end > post_start and co > ca_end else 0
+                ot_before = pre_shift + post_shift
+            ot2_start = max(ci, twenty_two)
+            ot_after = _minutes(co - ot2_start) if co > ot2_start else 0
+
+        # 4. Trừ đối ứng theo từng loại tăng ca
+        if comp_before_22 > 0:
+            ot_before = max(0, ot_before - comp_before_22)
+        if comp_after_22 > 0:
+            ot_after = max(0, ot_after - comp_after_22)
+        # Legacy: comp_time_overtime trừ phần trước 22h trước, còn dư trừ sang sau 22h
+        if comp_overtime > 0:
+            deduction = min(comp_overtime, ot_before + ot_after)
+            if deduction > 0:
+                deduct_before = min(ot_before, deduction)
+                ot_before -= deduct_before
+                deduction -= deduct_before
+                if deduction > 0:
+                    ot_after = max(0, ot_after - deduction)
+        # Lễ Việt Nam: giờ nghỉ trừ vào tăng ca trước 22h
+        if holiday_type == 'vietnamese_holiday' and ot_before > 0:
+            ot_before = max(0, ot_before - (inp.break_time_minutes or 60))
+
+        overtime_before_22 = minutes_to_hhmm(ot_before)
+        overtime_after_22 = minutes_to_hhmm(ot_after)
+    elif holiday_type == 'vietnamese_holiday':
+        regular_work_hours = 8.0
+        overtime_before_22 = "0:00"
+        overtime_after_22 = "0:00"
+    elif holiday_type == 'weekend':
+        regular_work_hours = 0.0
+        overtime_before_22, overtime_after_22 = _no_shift_weekend_overtime(inp)
+    elif holiday_type == 'japanese_holiday':
+        regular_base = min(total_work_hours or 0.0, 8.0)
+        regular_work_hours = round(max(0.0, regular_base - (comp_regular + comp_overtime) / 60.0), 2)
+        overtime_before_22, overtime_after_22 = _no_shift_japanese_overtime(inp, regular_work_hours)
+    # Ngày thường không có ca: giữ nguyên giờ công / tăng ca đang lưu
+
+    return ShiftResult(total_work_hours, regular_work_hours, overtime_before_22, overtime_after_22,
+                       shift_start, shift_end)
+
+
+def _no_shift_weekend_overtime(inp: ShiftInput):
+    """Cuối tuần không có ca chuẩn: tăng ca trước 22h = giờ làm tới 22h (hoặc giờ ra) - giờ nghỉ
+
+    Tính trên datetime như _no_shift_japanese_overtime (cách cũ trừ 2 giá trị time -> luôn TypeError)
+    """
+    twenty_two = time(22, 0)
+
+    if inp.check_in.time() < twenty_two:
+        before_end = min(inp.check_out, datetime.combine(inp.check_in.date(), twenty_two))
+        overtime_before_22 = max(0.0, (before_end - inp.check_in).total_seconds() / 3600)
+        overtime_before_22 = max(0.0, overtime_before_22 - inp.break_time)
+    else:
+        overtime_before_22 = 0.0
+    if inp.check_out.time() > twenty_two:
+        overtime_after_22 = (inp.check_out - datetime.combine(inp.check_out.date(), twenty_two)).total_seconds() / 3600
+    else:
+        overtime_after_22 = 0.0
+    return _minutes_to_hhmm_precise(overtime_before_22 * 60), _minutes_to_hhmm_precise(overtime_after_22 * 60)
+
+
+def _no_shift_japanese_overtime(inp: ShiftInput, regular_work_hours: float):
+    """Lễ Nhật không có ca chuẩn: tăng ca bắt đầu sau giờ công thường + giờ nghỉ"""
+    check_in_time = inp.check_in.time()
+    check_out_time = inp.check_out.time()
+    twenty_two = time(22, 0)
+
+    overtime_start = datetime.combine(inp.date, check_in_time) + timedelta(hours=regular_work_hours + inp.break_time)
+    if inp.check_out < inp.check_in:
+        twenty_two_datetime = datetime.combine(overtime_start.date(), twenty_two)
+        if overtime_start < twenty_two_datetime:
+            overtime_before_22 = (twenty_two_datetime - overtime_start).total_seconds() / 3600
+        else:
+            overtime_before_22 = 0.0
+    elif overtime_start.time() < twenty_two:
+        # Cách cũ trừ 2 giá trị time ở đây (luôn TypeError) -> tính trên datetime, tới 22h hoặc giờ ra
+        before_end = min(inp.check_out, datetime.combine(overtime_start.date(), twenty_two))
+        overtime_before_22 = max(0.0, (before_end - overtime_start).total_seconds() / 3600)
+    else:
+        overtime_before_22 = 0.0
+
+    if inp.check_out < inp.check_in:
+        twenty_two_datetime = datetime.combine(inp.check_out.date(), twenty_two)
+        if inp.check_out > twenty_two_datetime:
+            overtime_after_22 = (inp.check_out - twenty_two_datetime).total_seconds() / 3600
+        else:
+            overtime_after_22 = 0.0
+    elif check_out_time > twenty_two:
+        overtime_after_22 = (inp.check_out - datetime.combine(inp.check_out.date(), twenty_two)).total_seconds() / 3600
+    else:
+        overtime_after_22 = 0.0
+    return _minutes_to_hhmm_precise(overtime_before_22 * 60), _minutes_to_hhmm_precise(overtime_after_22 * 60)
+
+
+def calculate_regular_hours(inp: ShiftInput) -> float:
+    """Giờ công thường hiển thị (thay cho Attendance.calculate_regular_work_hours)"""
+    if not inp.check_in or not inp.check_out:
+        return 0.0
+
+    holiday_type = inp.holiday_type
+    # Ca 5: không có giờ công thường, trừ lễ Việt Nam (mặc định 8h)
+    if inp.shift_code == '5' and holiday_type != 'vietnamese_holiday':
+        return 0.0
+    if holiday_type == 'vietnamese_holiday':
+        return 8.0
+    if holiday_type == 'weekend':
+        return 0.0
+
+    def _cap_by_required(base_hours: float) -> float:
+        req = inp.required_hours
+        if req is not None and req > 0 and req < base_hours:
+            return req
+        return base_hours
+
+    comp_regular = inp.comp_time_regular_minutes or 0
+    if holiday_type == 'japanese_holiday':
+        if inp.total_work_hours is not None:
+            base = min(inp.total_work_hours, 8.0)
+        else:
+            duration_hours = (inp.check_out - inp.check_in).total_seconds() / 3600
+            base = min(max(0.0, duration_hours - inp.break_time), 8.0)
+        base = _cap_by_required(base)
+        return round(max(0.0, base - (comp_regular + (inp.comp_time_overtime_minutes or 0)) / 60.0), 2)
+
+    has_shift = inp.shift_start and inp.shift_end
+    if has_shift:
+        day_start = datetime.combine(inp.date, time())
+        ca_start, ca_end = _shift_window(day_start, inp.shift_start, inp.shift_end)
+        overlap_start = max(_us(inp.check_in - day_start), ca_start)
+        overlap_end = min(_us(inp.check_out - day_start), ca_end)
+        time_in_shift = round(max(0, _hours(overlap_end - overlap_start)), 2) if overlap_end > overlap_start else 0
+    else:
+        time_in_shift = (inp.check_out - inp.check_in).total_seconds() / 3600
+
+    effective_break = inp.break_time + comp_regular / 60.0
+    regular_hours = round(max(0, time_in_shift - effective_break), 2)
+    if _is_maternity_flex(inp):
+        # Mẹ <12 tháng: +1h, tối đa 8h (không trần theo required_hours)
+        return min(regular_hours + 1.0, 8.0)
+    return _cap_by_required(min(regular_hours, 8.0))
+
+
+def compute_batch(inputs: Iterable[ShiftInput]) -> List[ShiftResult]:
+    """compute_work_hours cho nhiều bản ghi"""
+    return [compute_work_hours(inp) for inp in inputs]
+
+
+# ---------------------------------------------------------------------------
+# Lô số học phút nguyên (NumPy)
+# ---------------------------------------------------------------------------
+
+_MISSING_SHIFT_ERROR = "compute_minutes_batch cần mã ca 1-5 (hoặc shift_start/shift_end) cho mọi bản ghi"
+
+# Giờ vào / ra ca chuẩn theo mã ca 0..5 (0 = không có ca)
+_SHIFT_START_MINUTES = [0] + [SHIFT_TABLE[str(i)].start_minutes for i in range(1, 6)]
+_SHIFT_END_MINUTES = [0] + [SHIFT_TABLE[str(i)].end_minutes for i in range(1, 6)]
+
+
+def _as_array(value, size: int):
+    array = np.asarray(value, dtype=np.int64)
+    if array.ndim == 0:
+        array = np.full(size, int(array), dtype=np.int64)
+    return array
+
+
+def compute_minutes_batch(check_in: Sequence[int], check_out: Sequence[int], shift_code: Sequence,
+                          day_type=DAY_NORMAL, break_minutes=60, comp_regular=0, comp_overtime=0,
+                          comp_before_22=0, comp_after_22=0, maternity=False,
+                          shift_start: Optional[Sequence[int]] = None, shift_end: Optional[Sequence[int]] = None,
+                          stored_total_minutes=0, stored_regular_minutes=0) -> Dict[str, object]:
+    """
+    Phút công / giờ công / OT trước-sau 22h cho nhiều bản ghi có ca.
+
+    check_in / check_out: phút tính từ 0h ngày chấm công (ra hôm sau thì > 1440).
+    shift_code: '1'..'5' (hoặc 1..5); shift_start + shift_end (phút, cả hai) thay cho giờ ca chuẩn.
+    day_type: DAY_NORMAL / DAY_WEEKEND / DAY_VIETNAMESE_HOLIDAY / DAY_JAPANESE_HOLIDAY.
+    Tham số còn lại nhận 1 giá trị cho cả lô hoặc mảng cùng độ dài.
+    stored_*_minutes: cột total_work_minutes / regular_work_minutes đang lưu (OT lễ Nhật đọc từ đây).
+
+    Trả về dict mảng số nguyên: work_minutes, regular_minutes, ot_before_22, ot_after_22.
+    Số học phút nguyên: giờ công có thể lệch <= 1 phút so với compute_work_hours (vốn làm tròn
+    giờ tới 0.01h); các cột còn lại trùng khớp.
+    """
+    codes = [str(code) if code is not None else '' for code in shift_code]
+    if np is None:
+        return _compute_minutes_batch_python(
+            check_in, check_out, codes, day_type, break_minutes, comp_regular, comp_overtime,
+            comp_before_22, comp_after_22, maternity, shift_start, shift_end,
+            stored_total_minutes, stored_regular_minutes)
+
+    ci = np.asarray(check_in, dtype=np.int64)
+    co = np.asarray(check_out, dtype=np.int64)
+    size = ci.shape[0]
+    code_numbers = np.array([int(code) if code in SHIFT_TABLE else 0 for code in codes], dtype=np.int64)
+    if shift_start is not None and shift_end is not None:
+        ca_start = _as_array(shift_start, size)
+        ca_end = _as_array(shift_end, size)
+        ca_end = np.where(ca_end <= ca_start, ca_end + 1440, ca_end)
+    else:
+        if (code_numbers == 0).any():
+            raise ValueError(_MISSING_SHIFT_ERROR)
+        ca_start = np.asarray(_SHIFT_START_MINUTES, dtype=np.int64)[code_numbers]
+        ca_end = np.asarray(_SHIFT_END_MINUTES, dtype=np.int64)[code_numbers]
+
+    day = _as_array(day_type, size)
+    brk = _as_array(break_minutes, size)
+    c_reg = _as_array(comp_regular, size)
+    c_ot = _as_array(comp_overtime, size)
+    c_b22 = _as_array(comp_before_22, size)
+    c_a22 = _as_array(comp_after_22, size)
+    mat = np.asarray(maternity, dtype=bool)
+    if mat.ndim == 0:
+        mat = np.full(size, bool(mat))
+
+    weekend = day == DAY_WEEKEND
+    vn = day == DAY_VIETNAMESE_HOLIDAY
+    jp = day == DAY_JAPANESE_HOLIDAY
+    # Chính sách mẹ <12 tháng chỉ áp dụng ngày thường, ca 1-4
+    mat = mat & ~(weekend | vn | jp) & (code_numbers >= 1) & (code_numbers <= 4)
+    shift5 = code_numbers == 5
+    t22 = TWENTY_TWO_MINUTES
+
+    # Tổng phút làm sau giờ nghỉ và đối ứng
+    comp_total = c_b22 + c_a22 + np.where(weekend | vn, 0, c_reg + c_ot)
+    work = np.maximum(0, np.maximum(0, co - ci - brk) - comp_total)
+
+    # Thời gian trong ca
+    overnight = (co // 1440) > (ci // 1440)
+    overlap = np.minimum(co, ca_end) - np.maximum(ci, ca_start)
+    in_shift = np.where(overnight, co - ci, np.maximum(0, overlap))
+
+    actual = np.maximum(0, in_shift - brk - c_reg)
+    boosted = actual + 60
+    bonus = np.where(mat, np.maximum(0, boosted - REGULAR_CAP_MINUTES), 0)
+    regular = np.where(shift5, 0, np.minimum(np.where(mat, boosted, actual), REGULAR_CAP_MINUTES))
+    regular = np.where(jp, np.maximum(0, np.minimum(work, REGULAR_CAP_MINUTES) - c_reg - c_ot), regular)
+    regular = np.where(weekend, 0, np.where(vn, REGULAR_CAP_MINUTES, regular))
+
+    # OT thô - ngày thường
+    after_22 = np.maximum(0, co - np.maximum(ci, t22))
+    pre_end = np.minimum(np.minimum(co, ca_start), t22)
+    pre_shift = np.where((pre_end > ci) & (ci < ca_start), pre_end - ci, 0)
+    post_end = np.minimum(co, t22)
+    post_shift = np.maximum(0, post_end - np.maximum(ci, ca_end))
+    raw_before_22 = np.maximum(0, np.minimum(co, t22) - ci)
+    before = np.where(shift5, raw_before_22 - np.minimum(raw_before_22, np.maximum(0, brk)), pre_shift + post_shift)
+    after = after_22
+    # Mẹ <12 tháng
+    before = np.where(mat, np.maximum(0, post_end - ca_end) + bonus, before)
+    after = np.where(mat, np.maximum(0, co - t22), after)
+    # Cuối tuần / lễ Việt Nam
+    off_break = np.where(brk > 0, brk, 60)
+    weekend_before = np.where(ci < t22, np.maximum(0, np.minimum(co, t22) - ci - off_break), 0)
+    before = np.where(weekend, weekend_before, np.where(vn, raw_before_22, before))
+    after = np.where(weekend, np.maximum(0, co - t22), after)
+    # Lễ Nhật: phân bổ OT (tổng đã lưu - giờ công đã lưu), ưu tiên sau 22h
+    s_total = _as_array(stored_total_minutes, size)
+    s_regular = _as_array(stored_regular_minutes, size)
+    jp_total = np.maximum(0, s_total - s_regular)
+    regular_end = ci + s_regular
+    jp_after = np.minimum(jp_total, np.maximum(0, co - np.maximum(regular_end, t22)))
+    jp_before = np.minimum(np.maximum(0, np.minimum(co, t22) - regular_end), jp_total - jp_after)
+    before = np.where(jp, np.where(jp_total > 0, jp_before, 0), before)
+    after = np.where(jp, np.where(jp_total > 0, jp_after, 0), after)
+
+    # Trừ đối ứng
+    before = np.maximum(0, before - c_b22)
+    after = np.maximum(0, after - c_a22)
+    deduction = np.minimum(c_ot, before + after)
+    deduct_before = np.minimum(before, deduction)
+    before = before - deduct_before
+    after = np.maximum(0, after - (deduction - deduct_before))
+    before = np.where(vn & (before > 0), np.maximum(0, before - off_break), before)
+
+    return {
+        'work_minutes': work,
+        'regular_minutes': regular,
+        'ot_before_22': before,
+        'ot_after_22': after,
+    }
+
+
+def _compute_minutes_batch_python(check_in, check_out, codes, day_type, break_minutes, comp_regular,
+                                  comp_overtime, comp_before_22, comp_after_22, maternity,
+                                  shift_start, shift_end, stored_total_minutes, stored_regular_minutes):
+    """Cùng công thức với compute_minutes_batch, vòng lặp thuần Python khi không có NumPy"""
+    size = len(check_in)
+
+    def column(value):
+        if isinstance(value, (list, tuple)):
+            return list(value)
+        if hasattr(value, 'tolist'):
+            return value.tolist()
+        return [value] * size
+
+    day, brk, c_reg, c_ot, c_b22, c_a22, mat, s_total, s_regular = (
+        column(v) for v in (day_type, break_minutes, comp_regular, comp_overtime, comp_before_22,
+                            comp_after_22, maternity, stored_total_minutes, stored_regular_minutes))
+    starts = column(shift_start) if shift_start is not None else None
+    ends = column(shift_end) if shift_end is not None else None
+    t22 = TWENTY_TWO_MINUTES
+    out = {'work_minutes': [], 'regular_minutes': [], 'ot_before_22': [], 'ot_after_22': []}
+
+    for i in range(size):
+        ci, co, code = check_in[i], check_out[i], codes[i]
+        if starts is not None and ends is not None:
+            ca_start = starts[i]
+            ca_end = ends[i] + 1440 if ends[i] <= starts[i] else ends[i]
+        else:
+            definition = SHIFT_TABLE.get(code)
+            if definition is None:
+                raise ValueError(_MISSING_SHIFT_ERROR)
+            ca_start, ca_end = definition.start_minutes, definition.end_minutes
+        kind = day[i]
+        is_mat = bool(mat[i]) and code in MATERNITY_SHIFT_CODES
+        off_break = brk[i] if brk[i] > 0 else 60
+
+        comp_total = c_b22[i] + c_a22[i] + (0 if kind in (DAY_WEEKEND, DAY_VIETNAMESE_HOLIDAY) else c_reg[i] + c_ot[i])
+        work = max(0, max(0, co - ci - brk[i]) - comp_total)
+
+        if co // 1440 > ci // 1440:
+            in_shift = co - ci
+        else:
+            in_shift = max(0, min(co, ca_end) - max(ci, ca_start))
+        actual = max(0, in_shift - brk[i] - c_reg[i])
+        bonus = 0
+        if kind == DAY_VIETNAMESE_HOLIDAY:
+            regular = REGULAR_CAP_MINUTES
+        elif kind == DAY_WEEKEND:
+            regular = 0
+        elif kind == DAY_JAPANESE_HOLIDAY:
+            regular = max(0, min(work, REGULAR_CAP_MINUTES) - c_reg[i] - c_ot[i])
+        elif is_mat:
+            regular = min(actual + 60, REGULAR_CAP_MINUTES)
+            bonus = max(0, actual + 60 - REGULAR_CAP_MINUTES)
+        elif code == '5':
+            regular = 0
+        else:
+            regular = min(actual, REGULAR_CAP_MINUTES)
+
+        raw_before_22 = max(0, min(co, t22) - ci)
+        post_shift = max(0, min(co, t22) - max(ci, ca_end))
+        if kind == DAY_VIETNAMESE_HOLIDAY:
+            before, after = raw_before_22, max(0, co - max(ci, t22))
+        elif kind == DAY_WEEKEND:
+            before = max(0, min(co, t22) - ci - off_break) if ci < t22 else 0
+            after = max(0, co - t22)
+        elif kind == DAY_JAPANESE_HOLIDAY:
+            jp_total = max(0, s_total[i] - s_regular[i])
+            before = after = 0
+            if jp_total > 0:
+                regular_end = ci + s_regular[i]
+                after = min(jp_total, max(0, co - max(regular_end, t22)))
+                before = min(max(0, min(co, t22) - regular_end), jp_total - after)
+        elif is_mat:
+            before, after = max(0, min(co, t22) - ca_end) + bonus, max(0, co - t22)
+        else:
+            if code == '5':
+                before = raw_before_22 - min(raw_before_22, max(0, brk[i]))
+            else:
+                pre_end = min(co, ca_start, t22)
+                before = (pre_end - ci if pre_end > ci and ci < ca_start else 0) + post_shift
+            after = max(0, co - max(ci, t22))
+
+        before = max(0, before - c_b22[i])
+        after = max(0, after - c_a22[i])
+        deduction = min(c_ot[i], before + after)
+        deduct_before = min(before, deduction)
+        before -= deduct_before
+        after = max(0, after - (deduction - deduct_before))
+        if kind == DAY_VIETNAMESE_HOLIDAY and before > 0:
+            before = max(0, before - off_break)
+
+        out['work_minutes'].append(work)
+        out['regular_minutes'].append(regular)
+        out['ot_before_22'].append(before)
+        out['ot_after_22'].append(after)
+    return out
@@ -0,0 +1,79 @@
+"""
+Cache ảnh chữ ký đã xử lý sẵn để vẽ lên PDF
+
+Giải mã base64 / Fernet + fit vào ô + resize 300 DPI + đổi màu bút bi tốn vài chục ms mỗi chữ ký.
+Trong export hàng loạt, cùng một chữ ký quản lý/trưởng nhóm lặp lại hàng trăm lần
+-> xử lý 1 lần, giữ ImageReader (ReportLab) trong LRU có giới hạn, khoá theo hash nội dung + kích thước ô.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get('SIGNATURE_IMAGE_CACHE_SIZE', 256))
+
+# Đánh dấu chữ ký không xử lý được (để không thử lại liên tục)
+_FAILED = object()
+
+
+def signature_content_key(signature_data, *extra: Hashable) -> tuple:
+    """Khoá cache: sha256 nội dung chữ ký (không giữ chuỗi base64 gốc làm key) + tham số vẽ"""
+    raw = signature_data if isinstance(signature_data, bytes) else str(signature_data).encode('utf-8', 'surrogatepass')
+    return (hashlib.sha256(raw).hexdigest(),) + extra
+
+
+class SignatureImageCache:
+    """LRU thread-safe cho ảnh chữ ký đã sẵn sàng để vẽ, có thống kê hit/miss"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_or_create(self, key: tuple, factory: Callable[[], Optional[Any]]) -> Optional[Any]:
+        """
+        Trả về giá trị đã cache cho key, hoặc gọi factory() để tạo rồi lưu lại.
+        factory trả về None = xử lý thất bại; kết quả này cũng được cache.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                value = self._entries[key]
+                return None if value is _FAILED else value
+            self._misses += 1
+
+        # Xử lý ngoài lock: 2 thread cùng miss một key chỉ tốn thêm 1 lần xử lý
+        value = factory()
+
+        with self._lock:
+            self._entries[key] = _FAILED if value is None else value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 3) if total else 0.0,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+# Global instance - dùng chung cho create_overtime_pdf, create_overtime_test_pdf và export hàng loạt
+signature_image_cache = SignatureImageCache()
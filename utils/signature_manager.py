@@ -12,8 +12,11 @@ import os
 from flask import session, request
 import logging
 from database.models import Attendance
-from utils.signature_processor import signature_processor
-from utils.signature_fit_adapter import signature_fit_adapter
+from utils.lazy_imports import lazy
+
+# OpenCV/NumPy/Pillow chỉ nạp khi thực sự xử lý chữ ký
+signature_processor = lazy('utils.signature_processor', 'signature_processor')
+signature_fit_adapter = lazy('utils.signature_fit_adapter', 'signature_fit_adapter')
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +43,10 @@ class SignatureManager:
 
         self.cipher = Fernet(app.config['SIGNATURE_SECRET_KEY'])
         self.session_timeout = app.config.get('SIGNATURE_SESSION_TIMEOUT', 1800)  # 30 phút
+
+    def init_cipher(self, secret_key):
+        """Chỉ dựng cipher giải mã (process không có Flask app, vd: worker render PDF)"""
+        self.cipher = Fernet(secret_key.encode() if isinstance(secret_key, str) else secret_key)
     
     def encrypt_signature(self, signature_data: str) -> str:
         """Mã hóa chữ ký"""
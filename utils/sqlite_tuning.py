@@ -0,0 +1,121 @@
+"""
+Cấu hình engine SQLAlchemy cho SQLite: pragma theo từng kết nối + pool phù hợp
+
+Mặc định SQLite dùng journal DELETE: 1 ghi là khoá cả file, người đọc cũng bị chặn,
+và không có busy_timeout nên thread nền (Google Sheet, email, backup...) va chạm với request
+-> "database is locked" ngay lập tức (get_activation_record phải tự retry + sleep).
+
+Profile mặc định (đặt ở mỗi kết nối mới):
+    journal_mode=WAL       : người đọc không chặn người ghi và ngược lại
+    synchronous=NORMAL     : an toàn với WAL, fsync ít hơn nhiều so với FULL
+    busy_timeout           : chờ khoá thay vì lỗi ngay (SQLITE_BUSY_TIMEOUT_MS)
+    cache_size, mmap_size  : giữ trang dữ liệu trong RAM / đọc qua mmap
+    temp_store=MEMORY      : bảng tạm của ORDER BY / GROUP BY không ghi ra đĩa
+
+Pool: SQLite chỉ cho 1 người ghi tại 1 thời điểm nên pool lớn (10 + 20 overflow) chỉ thêm
+kết nối chờ khoá; pool nhỏ không cần pre-ping/recycle (file cục bộ, không bị mất kết nối mạng).
+"""
+import logging
+import os
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, StaticPool
+
+logger = logging.getLogger(__name__)
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+SQLITE_PRAGMAS: Dict[str, object] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    # Số âm = KiB -> 64 MB cache mỗi kết nối
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64000)) * -1,
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE_MB', 256)) * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def is_sqlite_uri(uri: Optional[str]) -> bool:
+    return bool(uri) and uri.startswith('sqlite')
+
+
+def _is_memory_uri(uri: str) -> bool:
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+
+def sqlite_engine_options(uri: Optional[str], pool_size: Optional[int] = None) -> dict:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS cho URI; không phải SQLite -> giữ cấu hình pool cũ.
+    """
+    if not is_sqlite_uri(uri):
+        return {
+            'pool_pre_ping': True,
+            'pool_recycle': 300,
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+        }
+    connect_args = {
+        # Kết nối được trả về pool và dùng lại ở thread khác
+        'check_same_thread': False,
+        # Timeout (giây) của driver sqlite3 = busy handler, đồng bộ với PRAGMA busy_timeout
+        'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+    }
+    if _is_memory_uri(uri):
+        # DB trong RAM chỉ tồn tại trong 1 kết nối -> dùng chung đúng 1 kết nối
+        return {'poolclass': StaticPool, 'connect_args': connect_args}
+    pool_size = pool_size or int(os.environ.get('SQLITE_POOL_SIZE', 5))
+    return {
+        'poolclass': QueuePool,
+        'pool_size': pool_size,
+        'max_overflow': pool_size * 2,
+        'pool_timeout': SQLITE_BUSY_TIMEOUT_MS / 1000 + 5,
+        'connect_args': connect_args,
+    }
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: Optional[Dict[str, object]] = None) -> None:
+    """Đặt pragma cho 1 kết nối sqlite3 (DBAPI)"""
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_pragmas(engine: Engine, pragmas: Optional[Dict[str, object]] = None) -> bool:
+    """
+    Gắn hook "connect": mọi kết nối mới của engine được đặt pragma trước khi dùng.
+    Trả về False nếu engine không phải SQLite (không làm gì).
+    """
+    if engine.dialect.name != 'sqlite':
+        return False
+    profile = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+    if _is_memory_uri(str(engine.url)):
+        # WAL không áp dụng cho DB trong RAM
+        profile.pop('journal_mode', None)
+        profile.pop('mmap_size', None)
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        try:
+            apply_sqlite_pragmas(dbapi_connection, profile)
+        except Exception as e:
+            # Vd: file đang bị process khác giữ khoá khi chuyển sang WAL -> vẫn dùng được kết nối
+            logger.warning(f"Không đặt được PRAGMA SQLite: {e}")
+
+    logger.info(f"SQLite pragma profile: {profile}")
+    return True
+
+
+def read_sqlite_pragmas(connection, names=('journal_mode', 'synchronous', 'busy_timeout',
+                                           'cache_size', 'mmap_size', 'temp_store')) -> dict:
+    """Đọc giá trị pragma hiện tại (dùng cho trang thống kê / benchmark)"""
+    from sqlalchemy import text
+
+    return {name: connection.execute(text(f"PRAGMA {name}")).scalar() for name in names}
@@ -0,0 +1,256 @@
+"""
+Pub/sub broker cho các stream SSE (trạng thái email, trạng thái token/LICENSE)
+
+Trước đây mỗi worker giữ dict {user_id: [Queue]} riêng -> publish_email_status chỉ tới được
+client đang nối vào đúng worker đó, và mỗi stream poll q.get(timeout=1.0) liên tục.
+
+    - Kênh (channel) là chuỗi, vd: "email:12", "token_status"
+    - Subscription chờ bằng Condition (không poll); chỉ thức dậy khi có tin hoặc tới hạn keep-alive
+    - Backend chọn theo SSE_BROKER_URL (mặc định dùng REDIS_URL nếu có):
+        memory://             : trong process (dev / 1 worker)
+        redis://host:6379/0   : PUBLISH qua Redis, mỗi process có 1 thread nghe PSUBSCRIBE
+                                rồi phát lại cho subscriber cục bộ -> đúng với nhiều worker/máy
+
+Số kết nối SSE trên 1 worker phụ thuộc server WSGI: với worker gevent
+(gunicorn -k gevent --worker-connections 1000 app:app) mỗi stream chỉ là 1 greenlet,
+threading/queue đã được monkey-patch nên việc chờ ở đây nhường event loop thay vì giữ thread.
+"""
+import json
+import logging
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Số tin tối đa giữ cho 1 client chậm; vượt quá thì bỏ tin cũ nhất
+SSE_SUBSCRIBER_BUFFER = int(os.environ.get('SSE_SUBSCRIBER_BUFFER', 100))
+
+_REDIS_PREFIX = 'sse:'
+
+
+class Subscription:
+    """Hàng đợi của 1 client SSE trên 1 kênh"""
+
+    def __init__(self, broker: 'MemorySSEBroker', channel: str, maxlen: int = SSE_SUBSCRIBER_BUFFER):
+        self.broker = broker
+        self.channel = channel
+        self._items = deque(maxlen=maxlen)
+        self._cond = threading.Condition(threading.Lock())
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, payload: Any) -> None:
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(payload)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """Chờ tin kế tiếp; trả về None khi hết timeout hoặc subscription đã đóng"""
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemorySSEBroker:
+    """Broker trong process: chỉ phát cho subscriber của chính worker này"""
+
+    backend = 'memory'
+
+    def __init__(self):
+        self._subscribers: Dict[str, set] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._published = 0
+        self._delivered = 0
+
+    def subscribe(self, channel: str) -> Subscription:
+        sub = Subscription(self, channel)
+        with self._lock:
+            self._subscribers[channel].add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.channel)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.channel]
+
+    def publish(self, channel: str, payload: Any) -> int:
+        """Gửi payload (dict JSON được) tới mọi subscriber của kênh; trả về số subscriber cục bộ nhận được"""
+        self._published += 1
+        return self._deliver(channel, payload)
+
+    def _deliver(self, channel: str, payload: Any) -> int:
+        with self._lock:
+            subs = list(self._subscribers.get(channel, ()))
+        for sub in subs:
+            sub.put(payload)
+        self._delivered += len(subs)
+        return len(subs)
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            channels = {channel: len(subs) for channel, subs in self._subscribers.items()}
+        return {
+            'backend': self.backend,
+            'channels': len(channels),
+            'subscribers': sum(channels.values()),
+            'published': self._published,
+            'delivered_local': self._delivered,
+        }
+
+
+class RedisSSEBroker(MemorySSEBroker):
+    """
+    Broker qua Redis pub/sub: publish đi qua Redis, 1 thread nghe/process phát lại cho subscriber cục bộ.
+    Redis mất kết nối -> publish vẫn tới được client cùng worker, thread nghe tự kết nối lại.
+    """
+
+    backend = 'redis'
+    RECONNECT_DELAY = 2  # giây
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis  # Chỉ cần khi cấu hình Redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self._client.ping()
+        self._listener_client = redis.Redis.from_url(url, socket_connect_timeout=2)
+        self._stop = threading.Event()
+        self._redis_errors = 0
+        self._listener = threading.Thread(target=self._listen, name='sse-broker-redis', daemon=True)
+        self._listener.start()
+
+    def publish(self, channel: str, payload: Any) -> int:
+        self._published += 1
+        try:
+            self._client.publish(_REDIS_PREFIX + channel, json.dumps(payload, ensure_ascii=False))
+            # Subscriber cục bộ nhận qua thread nghe như mọi worker khác
+            return 0
+        except Exception as e:
+            self._redis_errors += 1
+            logger.warning(f"Không publish được SSE qua Redis ({e}), chỉ gửi trong worker hiện tại")
+            return self._deliver(channel, payload)
+
+    def _listen(self) -> None:
+        while not self._stop.is_set():
+            pubsub = self._listener_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(_REDIS_PREFIX + '*')
+                for message in pubsub.listen():
+                    if self._stop.is_set():
+                        break
+                    if message.get('type') != 'pmessage':
+                        continue
+                    channel = message['channel']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode('utf-8')
+                    try:
+                        payload = json.loads(message['data'])
+                    except (TypeError, ValueError):
+                        continue
+                    self._deliver(channel[len(_REDIS_PREFIX):], payload)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                self._redis_errors += 1
+                logger.warning(f"Mất kết nối Redis pub/sub cho SSE: {e}. Thử lại sau {self.RECONNECT_DELAY}s")
+                self._stop.wait(self.RECONNECT_DELAY)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['redis_errors'] = self._redis_errors
+        stats['listener_alive'] = self._listener.is_alive()
+        return stats
+
+
+def create_sse_broker(url: Optional[str] = None) -> MemorySSEBroker:
+    """Tạo broker theo URL; Redis lỗi -> broker trong process (chỉ tới client cùng worker)"""
+    url = (url or os.environ.get('SSE_BROKER_URL') or os.environ.get('REDIS_URL') or 'memory://').strip()
+    try:
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            return RedisSSEBroker(url)
+        if not url.startswith('memory://'):
+            logger.warning(f"SSE_BROKER_URL không hỗ trợ: {url}, dùng memory://")
+    except Exception as e:
+        logger.warning(f"Không kết nối được SSE broker {url}: {e}. Dùng memory:// (chỉ trong từng worker)")
+    return MemorySSEBroker()
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def iter_sse_stream(broker: MemorySSEBroker, channel: str, event: str, keepalive: float = 15,
+                    retry_ms: int = 3000, initial: Optional[Any] = None) -> Iterator[str]:
+    """
+    Sinh nội dung text/event-stream cho 1 kênh.
+    Chờ tin tới tối đa keepalive giây rồi gửi comment keep-alive (cũng giúp phát hiện client đã ngắt).
+    Chỉ subscribe ở lần next() đầu tiên và đóng subscription khi generator kết thúc/bị huỷ: view lỗi
+    trước khi trả Response, hay client ngắt trước khi body được đọc, thì không để lại subscriber nào.
+    """
+    sub = broker.subscribe(channel)
+    try:
+        yield f"retry: {retry_ms}\n\n"
+        if initial is not None:
+            yield format_sse(event, initial)
+        while not sub.closed:
+            item = sub.get(timeout=keepalive)
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event, item)
+    finally:
+        sub.close()
+
+
+class _LazyBroker:
+    """Tạo broker thật ở lần dùng đầu tiên (sau khi .env đã được nạp)"""
+
+    def __init__(self):
+        self._broker: Optional[MemorySSEBroker] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> MemorySSEBroker:
+        if self._broker is None:
+            with self._lock:
+                if self._broker is None:
+                    self._broker = create_sse_broker()
+                    logger.info(f"SSE broker: {self._broker.backend}")
+        return self._broker
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+# Global instance dùng cho /sse/email-status và /sse/token-status
+sse_broker = _LazyBroker()